@@ -8,18 +8,25 @@ from flask import Flask, render_template, redirect, url_for, current_app
 from flask_login import LoginManager
 from extensions import csrf
 from utils.formatadores import formatar_moeda
+from utils.partida import Cronometro, rodar_manutencao
 
 
-def register_blueprints_from_routes(app):
+def register_blueprints_from_routes(app, cron=None):
     """
     Varre o pacote `routes` e tenta importar cada módulo.
     Se o módulo expuser `bp` ou qualquer atributo terminado em '_bp' (Blueprint)
     ele é registrado automaticamente.
     Exceções de import são logadas para diagnóstico (não interrompem o registro).
+    Com `cron` (utils.partida.Cronometro), cronometra o import de cada módulo.
     """
     ...
     try:
-        import routes  # pacote que contém os módulos de rota (routes/*.py)
+        if cron is not None:
+            # routes/__init__.py já importa parte dos módulos (aliases).
+            with cron.etapa('routes (pacote)'):
+                import routes  # pacote que contém os módulos de rota (routes/*.py)
+        else:
+            import routes  # pacote que contém os módulos de rota (routes/*.py)
     except Exception:
         app.logger.warning("Pacote 'routes' não encontrado; nenhum blueprint será registrado automaticamente.")
         return
@@ -27,7 +34,11 @@ def register_blueprints_from_routes(app):
     for finder, name, ispkg in pkgutil.iter_modules(routes.__path__):
         modname = f"{routes.__name__}.{name}"
         try:
-            module = importlib.import_module(modname)
+            if cron is not None:
+                with cron.etapa(modname):
+                    module = importlib.import_module(modname)
+            else:
+                module = importlib.import_module(modname)
             
             # Procurar por 'bp' ou qualquer variável terminada em '_bp'
             blueprint_found = False
@@ -110,7 +121,9 @@ def _ensure_lucro_postos_tables(app):
     não existirem no banco.  Usa CREATE TABLE IF NOT EXISTS para idempotência total —
     seguro executar a cada restart.
     """
+    from routes.conf_fornecedores_dfe import _DDL_RAZAO, _SUJA_TUDO, _gatilhos_razao
     from utils.db import get_db_connection
+    from utils.gatilhos import sincronizar_gatilhos
 
     # DDLs idempotentes — ordem importa por causa de FK constraints
     statements = [
@@ -200,7 +213,30 @@ def _ensure_lucro_postos_tables(app):
             INDEX `idx_resumo_produto` (`produto_id`)
         ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
         """,
-        # 5. estoque_inicial_global — registro único imutável por cliente+produto
+        # 5. fifo_checkpoint_diario — camadas FIFO no início de um dia (cache de replay)
+        """
+        CREATE TABLE IF NOT EXISTS `fifo_checkpoint_diario` (
+            `id` INT AUTO_INCREMENT PRIMARY KEY,
+            `cliente_id` INT NOT NULL,
+            `produto_id` INT NOT NULL,
+            `data` DATE NOT NULL,
+            `camadas` MEDIUMTEXT NOT NULL,
+            `criado_em` DATETIME DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE KEY `uk_fifo_checkpoint` (`cliente_id`, `produto_id`, `data`)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+        """,
+        # 5b. fifo_checkpoint_versao — sobe a cada movimento que invalida
+        # checkpoints do cliente+produto; o relatório só grava checkpoint se a
+        # versão ainda é a que ele leu antes do replay (routes/relatorios.py)
+        """
+        CREATE TABLE IF NOT EXISTS `fifo_checkpoint_versao` (
+            `cliente_id` INT NOT NULL,
+            `produto_id` INT NOT NULL,
+            `versao` BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (`cliente_id`, `produto_id`)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+        """,
+        # 6. estoque_inicial_global — registro único imutável por cliente+produto
         """
         CREATE TABLE IF NOT EXISTS `estoque_inicial_global` (
             `id` INT AUTO_INCREMENT PRIMARY KEY,
@@ -218,10 +254,10 @@ def _ensure_lucro_postos_tables(app):
         """,
     ]
 
-    # Triggers para estoque_inicial_global (não suportam IF NOT EXISTS no MySQL —
-    # usamos DROP TRIGGER IF EXISTS antes de cada CREATE)
+    # Triggers para estoque_inicial_global. Não suportam IF NOT EXISTS no MySQL:
+    # utils.gatilhos.sincronizar_gatilhos só refaz (DROP + CREATE) os que
+    # faltam ou cujo corpo mudou.
     trigger_statements = [
-        "DROP TRIGGER IF EXISTS `prevent_update_eig`",
         """
         CREATE TRIGGER `prevent_update_eig`
         BEFORE UPDATE ON `estoque_inicial_global`
@@ -231,7 +267,6 @@ def _ensure_lucro_postos_tables(app):
                 SET MESSAGE_TEXT = 'Updates are not allowed on estoque_inicial_global';
         END
         """,
-        "DROP TRIGGER IF EXISTS `prevent_delete_eig`",
         """
         CREATE TRIGGER `prevent_delete_eig`
         BEFORE DELETE ON `estoque_inicial_global`
@@ -243,16 +278,78 @@ def _ensure_lucro_postos_tables(app):
         """,
     ]
 
+    # Triggers de invalidação de fifo_checkpoint_diario: um checkpoint do dia D
+    # reflete todos os movimentos anteriores a D, então qualquer alteração em
+    # fretes/vendas_posto na data X derruba os checkpoints com data > X. No
+    # UPDATE a linha pode ter mudado de data/cliente/produto — cobre OLD e NEW.
+    # Antes do DELETE sobe fifo_checkpoint_versao: o relatório que fez o
+    # replay com os dados antigos e grava depois do DELETE vê a versão nova e
+    # descarta o que calculou.
+    _ckpt_del = "DELETE FROM `fifo_checkpoint_diario` WHERE "
+    _ckpt_versao = ("INSERT INTO `fifo_checkpoint_versao` (cliente_id, produto_id, versao)"
+                    " VALUES ({r}.{c}, {r}.produto_id, 1)"
+                    " ON DUPLICATE KEY UPDATE versao = versao + 1; ")
+    _ckpt_fretes = "(cliente_id = {r}.clientes_id AND produto_id = {r}.produto_id AND data > {r}.data_frete)"
+    _ckpt_vendas = "(cliente_id = {r}.cliente_id AND produto_id = {r}.produto_id AND data > {r}.data_movimento)"
+    _ckpt_abertura = "(cliente_id = {r}.cliente_id AND produto_id = {r}.produto_id)"
+    for tabela, coluna_cliente, cond, sufixo in (
+        ('fretes', 'clientes_id', _ckpt_fretes, 'fretes'),
+        ('vendas_posto', 'cliente_id', _ckpt_vendas, 'vendas'),
+        ('fifo_abertura', 'cliente_id', _ckpt_abertura, 'abertura'),
+    ):
+        for evento, linhas in (('INSERT', ('NEW',)),
+                               ('UPDATE', ('OLD', 'NEW')),
+                               ('DELETE', ('OLD',))):
+            nome = f"fifo_ckpt_{sufixo}_{evento.lower()}"
+            trigger_statements.append(
+                f"CREATE TRIGGER `{nome}` AFTER {evento} ON `{tabela}` FOR EACH ROW BEGIN "
+                + "".join(_ckpt_versao.format(r=r, c=coluna_cliente) for r in linhas)
+                + _ckpt_del + " OR ".join(cond.format(r=r) for r in linhas) + "; END"
+            )
+
+    # A quantidade de um frete pode vir de quantidades.valor (COALESCE com
+    # quantidade_manual no replay): mudar ou apagar o valor mexe em todos os
+    # fretes que apontam para ele.
+    _ckpt_quantidade = (
+        "INSERT INTO `fifo_checkpoint_versao` (cliente_id, produto_id, versao)"
+        " SELECT DISTINCT f.clientes_id, f.produto_id, 1 FROM `fretes` f"
+        " WHERE f.quantidade_id = OLD.id"
+        " ON DUPLICATE KEY UPDATE versao = `fifo_checkpoint_versao`.versao + 1; "
+        "DELETE c FROM `fifo_checkpoint_diario` c JOIN `fretes` f"
+        " ON f.clientes_id = c.cliente_id AND f.produto_id = c.produto_id"
+        " AND c.data > f.data_frete WHERE f.quantidade_id = OLD.id; "
+    )
+    trigger_statements += [
+        "CREATE TRIGGER `fifo_ckpt_quantidades_update` AFTER UPDATE ON `quantidades`"
+        " FOR EACH ROW BEGIN IF NOT (OLD.valor <=> NEW.valor) THEN "
+        + _ckpt_quantidade + "END IF; END",
+        "CREATE TRIGGER `fifo_ckpt_quantidades_delete` AFTER DELETE ON `quantidades`"
+        " FOR EACH ROW BEGIN " + _ckpt_quantidade + "END",
+    ]
+
+    # Gatilhos do razão da conferência de fornecedores (routes/conf_fornecedores_dfe.py):
+    # as tabelas do razão vêm antes — gatilho apontando para tabela que não
+    # existe derrubaria toda gravação no extrato.
+    statements.extend(_DDL_RAZAO)
+    gatilhos_razao = [ddl for _nome, ddl in _gatilhos_razao()]
+
     try:
         conn = get_db_connection()
         cur = conn.cursor()
         try:
             for ddl in statements:
                 cur.execute(ddl)
-            for stmt in trigger_statements:
-                cur.execute(stmt)
+            refeitos = sincronizar_gatilhos(cur, trigger_statements + gatilhos_razao)
+            # Gravação que caiu entre o DROP e o CREATE não invalidou nada:
+            # quem teve gatilho refeito descarta o que tem em cache.
+            if any(n.startswith('fifo_ckpt_') for n in refeitos):
+                cur.execute("UPDATE `fifo_checkpoint_versao` SET versao = versao + 1")
+                cur.execute("DELETE FROM `fifo_checkpoint_diario`")
+            if any(n.startswith('razao_dfe_') for n in refeitos):
+                cur.execute(_SUJA_TUDO)
             conn.commit()
-            app.logger.info("Tabelas Lucro Postos (FIFO) e estoque_inicial_global verificadas/criadas.")
+            app.logger.info("Tabelas Lucro Postos (FIFO) e estoque_inicial_global verificadas/criadas"
+                            " (%d gatilho(s) refeito(s)).", len(refeitos))
         finally:
             cur.close()
             conn.close()
@@ -263,6 +360,38 @@ def _ensure_lucro_postos_tables(app):
         )
 
 
+def _migrations(app):
+    # Executa todas as migrations SQL pendentes em /migrations/ e, em seguida,
+    # as garantias de schema das rotas (utils/schema_registry.py). Cria a
+    # tabela schema_migrations se não existir e aplica cada arquivo .sql
+    # exatamente uma vez, em ordem alfabética (prefixo YYYYMMDD garante cronologia).
+    from utils.migrations_runner import run_pending_migrations
+    run_pending_migrations(app)
+
+
+def _correcoes_bank_import(app):
+    # Correções de dados de bank_import. As colunas que elas usam
+    # (descricao_chave, bank_transaction_id, ...) já foram garantidas na etapa
+    # anterior.
+    from routes.bank_import import _cleanup_orphaned_lancamentos_despesas, _fix_auto_regra_subcategoria
+    _cleanup_orphaned_lancamentos_despesas()
+    _fix_auto_regra_subcategoria()
+
+
+def _agendador_no_web(app):
+    # Os jobs periodicos (dfe, els, efi, dashboard) rodam no processo
+    # `scheduler` do Procfile (integrations/agendador.py). AGENDADOR_NO_WEB=1
+    # volta a liga-los dentro dos workers web, para deploy sem esse processo;
+    # o GET_LOCK de cada job segura os workers. Falha ao ligar NAO derruba o app.
+    from integrations import agendador
+    if not agendador.NO_WEB or os.environ.get('AGENDADOR_PROCESSO') == '1':
+        return
+    try:
+        agendador.iniciar_no_processo(app)
+    except Exception:
+        app.logger.warning("[agendador] nao foi possivel iniciar no worker web.", exc_info=True)
+
+
 def create_app():
     app = Flask(__name__, static_folder='static', template_folder='templates')
     
@@ -273,6 +402,11 @@ def create_app():
     # CSRF protection
     csrf.init_app(app)
 
+    # Conexão de banco por request (utils.db.get_request_connection):
+    # devolvida ao pool no teardown do app context.
+    from utils import db as db_utils
+    db_utils.init_app(app)
+
     # Initialize SQLAlchemy
     from models import db
     db.init_app(app)
@@ -316,99 +450,12 @@ def create_app():
     app.logger.info("="*60)
     app.logger.info("Iniciando registro automático de blueprints...")
     app.logger.info("="*60)
-    register_blueprints_from_routes(app)
+    cron = Cronometro('import das rotas')
+    register_blueprints_from_routes(app, cron)
     app.logger.info("="*60)
     app.logger.info("Registro de blueprints concluído!")
     app.logger.info("="*60)
-
-    # Executa todas as migrations SQL pendentes em /migrations/ na inicialização.
-    # Cria a tabela schema_migrations se não existir e aplica cada arquivo .sql
-    # exatamente uma vez, em ordem alfabética (prefixo YYYYMMDD garante cronologia).
-    with app.app_context():
-        try:
-            from utils.migrations_runner import run_pending_migrations
-            run_pending_migrations(app)
-        except Exception:
-            app.logger.warning(
-                "Migration runner falhou na inicialização (não crítico).",
-                exc_info=True,
-            )
-
-    # Executa migrations opcionais de schema na inicialização do servidor.
-    # Garante que as colunas adicionadas em versões recentes (descricao_chave,
-    # bank_transaction_id, etc.) existam antes da primeira request, evitando
-    # lentidão de 10-30 s no primeiro acesso após cada deployment.
-    with app.app_context():
-        try:
-            from routes.bank_import import _ensure_ld_bank_tx_id, _ensure_descricao_chave, _cleanup_orphaned_lancamentos_despesas, _fix_auto_regra_subcategoria
-            _ensure_ld_bank_tx_id()
-            _ensure_descricao_chave()
-            _cleanup_orphaned_lancamentos_despesas()
-            _fix_auto_regra_subcategoria()
-            app.logger.info("Migrations de schema de bank_import executadas na inicialização.")
-        except Exception:
-            app.logger.warning(
-                "Migrations de bank_import falharam na inicialização "
-                "(não crítico – serão reexecutadas na primeira request).",
-                exc_info=True,
-            )
-        # Garante que cooldowns de retry sejam zerados após a inicialização,
-        # de modo que a primeira request possa tentar novamente imediatamente
-        # mesmo que a migration tenha falhado durante o startup.
-        try:
-            import routes.bank_import as _bi
-            if not _bi._bsm_descricao_chave_ready:
-                _bi._bsm_descricao_chave_retry_after = 0.0
-            if not _bi._ld_bank_tx_id_ready:
-                _bi._ld_bank_tx_id_retry_after = 0.0
-        except Exception:
-            pass
-
-    # Cria as tabelas do módulo Lucro Postos (FIFO) e Estoque Inicial Global na
-    # primeira inicialização, usando CREATE TABLE IF NOT EXISTS para idempotência.
-    with app.app_context():
-        _ensure_lucro_postos_tables(app)
-
-    # Garante que a bandeira de cartão 'CABAL / OUTROS' (DÉBITO) exista no banco.
-    with app.app_context():
-        try:
-            from routes.cartoes import _ensure_cabal_debito
-            _ensure_cabal_debito()
-            app.logger.info("Seed de bandeira CABAL / OUTROS executado na inicialização.")
-        except Exception:
-            app.logger.warning(
-                "Seed de bandeira CABAL / OUTROS falhou na inicialização (não crítico).",
-                exc_info=True,
-            )
-
-    # Garante que VENDA PROGRAMADA (forma_pagamento) e ANTECIPAÇÃO CLIENTE
-    # (tipo_receita) existam no banco — equivalente à migration 20260327 mas
-    # executado automaticamente a cada deploy para não depender de script manual.
-    with app.app_context():
-        try:
-            from routes.lancamentos_caixa import _ensure_caixa_formas_tipos
-            _ensure_caixa_formas_tipos()
-            app.logger.info(
-                "Seed de VENDA PROGRAMADA / ANTECIPAÇÃO CLIENTE executado na inicialização."
-            )
-        except Exception:
-            app.logger.warning(
-                "Seed de VENDA PROGRAMADA / ANTECIPAÇÃO CLIENTE falhou na inicialização "
-                "(não crítico).",
-                exc_info=True,
-            )
-
-    # Garante que as quantidades 9.000 e 12.000 litros existam na tabela quantidades.
-    with app.app_context():
-        try:
-            from routes.pedidos import _ensure_quantidades_extras
-            _ensure_quantidades_extras()
-            app.logger.info("Seed de quantidades 9.000/12.000 litros executado na inicialização.")
-        except Exception:
-            app.logger.warning(
-                "Seed de quantidades 9.000/12.000 litros falhou na inicialização (não crítico).",
-                exc_info=True,
-            )
+    cron.relatorio(app.logger, top=10)
 
     # Registrar filtro e helpers de template
     app.jinja_env.filters['formatar_moeda'] = formatar_moeda
@@ -475,32 +522,19 @@ def create_app():
         except Exception:
             return "500 - Erro interno do servidor", 500
 
-    # Agendador da captura automatica de DFe (de hora em hora; lock global no
-    # MySQL garante execucao unica mesmo com varios workers). Falha aqui NAO
-    # deve derrubar o app.
-    try:
-        from integrations.dfe_scheduler import iniciar_scheduler
-        iniciar_scheduler(app)
-    except Exception:
-        app.logger.warning("[dfe_sched] nao foi possivel iniciar o scheduler.", exc_info=True)
-
-    # Agendador da importacao automatica do ELS por e-mail (a cada 10 min; lock
-    # global no MySQL garante execucao unica mesmo com varios workers). Falha
-    # aqui NAO deve derrubar o app.
-    try:
-        from integrations.els_scheduler import iniciar_scheduler as iniciar_els
-        iniciar_els(app)
-    except Exception:
-        app.logger.warning("[els_sched] nao foi possivel iniciar o scheduler.", exc_info=True)
-
-    # Agendador da baixa automatica dos boletos da EFI. O caminho normal e o
-    # webhook; este e a rede de seguranca para quando a notificacao nao chega —
-    # que e uma falha silenciosa dos dois lados. Falha aqui NAO derruba o app.
-    try:
-        from integrations.efi_scheduler import iniciar_scheduler as iniciar_efi
-        iniciar_efi(app)
-    except Exception:
-        app.logger.warning("[efi_sched] nao foi possivel iniciar o scheduler.", exc_info=True)
+    # Manutenção de schema FORA do caminho do worker (utils/partida.py): uma
+    # thread, serializada entre os workers por GET_LOCK, roda as migrations
+    # .sql + garantias das rotas, as correções de bank_import e as tabelas do
+    # Lucro Postos. Os jobs periódicos ficam no processo do agendador
+    # (Procfile `scheduler:`). STARTUP_DDL=sync volta ao comportamento
+    # bloqueante.
+    rodar_manutencao(app, etapas=(
+        ('migrations + garantias de schema', _migrations),
+        ('bank_import: correções de dados', _correcoes_bank_import),
+        ('lucro postos: tabelas', _ensure_lucro_postos_tables),
+    ), depois=(
+        ('agendador no worker web (AGENDADOR_NO_WEB)', _agendador_no_web),
+    ))
 
     return app
 
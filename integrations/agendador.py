@@ -0,0 +1,380 @@
+"""
+integrations/agendador.py
+=========================
+
+Processo DEDICADO dos jobs periódicos (Procfile: `scheduler: python -m
+integrations.agendador`).
+
+Antes cada worker do gunicorn ligava os seus quatro BackgroundScheduler
+(dfe, els, efi, dashboard) e disputava o GET_LOCK de cada job; o botão
+"Capturar agora" abria uma thread de captura dentro do worker web, que
+segurava uma conexão e um subprocess enquanto o worker atendia HTTP. Agora:
+
+  - REGISTRO: cada módulo de agendamento (dfe_scheduler, els_scheduler,
+    efi_scheduler, dashboard_scheduler) declara os seus jobs em jobs() --
+    nome, função, gatilho cron/intervalo. registro() junta todos.
+  - PROCESSO: main() sobe o app (config, logger, app_context), liga UM
+    APScheduler com o registro e fica num laço que lê a fila a cada
+    AGENDADOR_FILA_SEG segundos. Os workers web só atendem HTTP.
+  - FILA: enfileirar() (rotas "disparar agora") grava um pedido em
+    agendador_execucoes com status 'fila'; o processo reivindica com UPDATE
+    ... WHERE status='fila' e roda numa thread. Pedido repetido para o mesmo
+    job enquanto o anterior espera não duplica.
+  - SOBREPOSIÇÃO: um job nunca roda duas vezes ao mesmo tempo no processo
+    (lock por job, além de max_instances=1 do APScheduler); o GET_LOCK no
+    MySQL que cada job já usava continua valendo entre processos (deploy com
+    o processo antigo ainda de pé).
+  - HISTÓRICO E MÉTRICAS: cada rodada vira uma linha em agendador_execucoes
+    (origem, status ok/pulado/erro, duração, linhas processadas, detalhe);
+    agendador_jobs guarda por job a última rodada, contadores e a próxima
+    execução. GET /agendador/status mostra as duas.
+
+Cada função de job recebe (app, origem) e devolve resultado(...) ou None
+(= ok, sem contagem). Exceção vira status 'erro' com a mensagem no detalhe.
+
+Env:
+    AGENDADOR_FILA_SEG       = intervalo de leitura da fila (default 5)
+    AGENDADOR_HISTORICO_DIAS = histórico mantido (default 30)
+    AGENDADOR_NO_WEB         = '1' liga o agendador DENTRO dos workers web,
+                               como antes (deploy sem o processo `scheduler`).
+                               Default '0'.
+Os *_SCHED_ENABLED de cada módulo continuam valendo: job desligado não
+entra no cron, mas ainda roda quando pedido pela fila.
+"""
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+
+FILA_SEG = float(os.environ.get('AGENDADOR_FILA_SEG', 5))
+HISTORICO_DIAS = int(os.environ.get('AGENDADOR_HISTORICO_DIAS', 30))
+NO_WEB = os.environ.get('AGENDADOR_NO_WEB', '0') == '1'
+BATIMENTO_SEG = 30
+VIVO_SEG = 180       # sem batimento há mais que isso: processo fora do ar
+
+PROCESSO = '%s:%d' % (socket.gethostname(), os.getpid())
+
+
+def resultado(status='ok', linhas=None, detalhe=None):
+    """O que uma função de job devolve: status 'ok' | 'pulado' | 'erro'."""
+    return {'status': status, 'linhas': linhas, 'detalhe': detalhe}
+
+
+def fuso():
+    """America/Sao_Paulo (pytz, o que o APScheduler 3.x aceita) ou None."""
+    try:
+        import pytz
+        return pytz.timezone('America/Sao_Paulo')
+    except Exception:
+        return None
+
+
+class Job:
+    """Um job do registro. `gatilho` é 'cron' ou 'interval'; `agenda` são os
+    argumentos do gatilho (hour=..., minute=... / minutes=...)."""
+
+    def __init__(self, nome, fn, gatilho, descricao='', automatico=True,
+                 misfire=300, **agenda):
+        self.nome = nome
+        self.fn = fn
+        self.gatilho = gatilho
+        self.agenda = agenda
+        self.descricao = descricao
+        self.automatico = automatico
+        self.misfire = misfire
+        self.rodando = threading.Lock()
+
+    def agenda_texto(self):
+        args = ' '.join('%s=%s' % kv for kv in sorted(self.agenda.items()))
+        return '%s %s' % (self.gatilho, args) if self.automatico else 'só manual'
+
+
+def _job_limpeza(app, origem):
+    conn = _conectar()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            "DELETE FROM agendador_execucoes "
+            "WHERE pedido_em < NOW() - INTERVAL %s DAY AND status <> 'fila'",
+            (HISTORICO_DIAS,))
+        n = cur.rowcount
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+    return resultado(linhas=n)
+
+
+def registro():
+    """Todos os jobs periódicos do sistema, na ordem em que aparecem."""
+    from integrations import (dashboard_scheduler, dfe_scheduler, efi_scheduler,
+                              els_scheduler)
+    jobs = []
+    for modulo in (dfe_scheduler, els_scheduler, efi_scheduler, dashboard_scheduler):
+        jobs.extend(modulo.jobs())
+    jobs.append(Job('agendador_limpeza', _job_limpeza, 'cron',
+                    descricao='apaga o histórico do agendador mais velho que '
+                              '%d dias' % HISTORICO_DIAS,
+                    hour='3', minute='30'))
+    return jobs
+
+
+def _conectar():
+    from utils.db import get_db_connection
+    return get_db_connection()
+
+
+# ---------------------------------------------------------------- web (fila)
+def enfileirar(nome, pedido_por=None, origem='manual', conn=None):
+    """Pede ao processo do agendador uma rodada de `nome` já.
+
+    Se o job já tem pedido esperando na fila, não cria outro. Devolve
+    (id do pedido, novo?). Levanta se o banco não responder -- a rota decide
+    a mensagem."""
+    proprio = conn is None
+    conn = conn or _conectar()
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT id FROM agendador_execucoes "
+                    "WHERE job = %s AND status = 'fila' ORDER BY id LIMIT 1", (nome,))
+        row = cur.fetchone()
+        if row:
+            return row[0], False
+        cur.execute(
+            "INSERT INTO agendador_execucoes (job, origem, status, pedido_por, pedido_em) "
+            "VALUES (%s, %s, 'fila', %s, NOW())",
+            (nome, origem, (pedido_por or '')[:120] or None))
+        conn.commit()
+        return cur.lastrowid, True
+    finally:
+        cur.close()
+        if proprio:
+            conn.close()
+
+
+def processo_vivo(cur):
+    """True se o processo do agendador deu sinal nos últimos VIVO_SEG.
+    Cursor comum (tupla)."""
+    cur.execute("SELECT MAX(visto_em) >= NOW() - INTERVAL %s SECOND FROM agendador_jobs",
+                (VIVO_SEG,))
+    row = cur.fetchone()
+    return bool(row and row[0])
+
+
+# ------------------------------------------------------------------- processo
+class Agendador:
+    """Roda os jobs do registro: cron (APScheduler) + fila do banco."""
+
+    def __init__(self, app, jobs, conectar=None):
+        self.app = app
+        self.jobs = {j.nome: j for j in jobs}
+        self._conectar = conectar or _conectar
+        self._sched = None
+        self._parar = threading.Event()
+
+    # -------------------------------------------------------------- banco
+    def _gravar(self, sql, params=()):
+        """Escrita de histórico: best-effort -- banco fora não impede o job."""
+        try:
+            conn = self._conectar()
+            cur = conn.cursor()
+            try:
+                cur.execute(sql, params)
+                conn.commit()
+                return cur.lastrowid
+            finally:
+                cur.close()
+                conn.close()
+        except Exception:
+            self.app.logger.warning("[agendador] não gravou o histórico.", exc_info=True)
+            return None
+
+    def _abrir(self, nome, origem):
+        return self._gravar(
+            "INSERT INTO agendador_execucoes (job, origem, status, pedido_em, inicio, processo) "
+            "VALUES (%s, %s, 'rodando', NOW(), NOW(), %s)", (nome, origem, PROCESSO))
+
+    def _fechar(self, execucao_id, nome, r, ms):
+        detalhe = (r.get('detalhe') or None) and str(r['detalhe'])[:500]
+        if execucao_id:
+            self._gravar(
+                "UPDATE agendador_execucoes SET status = %s, fim = NOW(), duracao_ms = %s, "
+                "linhas = %s, detalhe = %s WHERE id = %s",
+                (r['status'], ms, r.get('linhas'), detalhe, execucao_id))
+        self._gravar(
+            "INSERT INTO agendador_jobs (job, ultima_execucao, ultimo_status, ultima_duracao_ms, "
+            "ultimas_linhas, execucoes, falhas, proxima_execucao, visto_em) "
+            "VALUES (%s, NOW(), %s, %s, %s, 1, %s, %s, NOW()) "
+            "ON DUPLICATE KEY UPDATE ultima_execucao = VALUES(ultima_execucao), "
+            "ultimo_status = VALUES(ultimo_status), ultima_duracao_ms = VALUES(ultima_duracao_ms), "
+            "ultimas_linhas = VALUES(ultimas_linhas), execucoes = execucoes + 1, "
+            "falhas = falhas + VALUES(falhas), proxima_execucao = VALUES(proxima_execucao), "
+            "visto_em = NOW()",
+            (nome, r['status'], ms, r.get('linhas'), int(r['status'] == 'erro'),
+             self.proxima(nome)))
+
+    def proxima(self, nome):
+        """Próxima execução agendada (horário de Brasília, sem tz) ou None."""
+        if self._sched is None:
+            return None
+        job = self._sched.get_job(nome)
+        quando = getattr(job, 'next_run_time', None)
+        return quando.replace(tzinfo=None) if quando else None
+
+    def batimento(self):
+        """Registra os jobs (descrição, agenda, próxima execução) e o sinal de
+        vida do processo -- também nas rodadas que ele tem em andamento, que é
+        o que _encerrar_orfas de outro processo olha."""
+        self._gravar(
+            "UPDATE agendador_execucoes SET visto_em = NOW() "
+            "WHERE status = 'rodando' AND processo = %s", (PROCESSO,))
+        for job in self.jobs.values():
+            self._gravar(
+                "INSERT INTO agendador_jobs (job, descricao, agenda, automatico, "
+                "proxima_execucao, visto_em) VALUES (%s, %s, %s, %s, %s, NOW()) "
+                "ON DUPLICATE KEY UPDATE descricao = VALUES(descricao), "
+                "agenda = VALUES(agenda), automatico = VALUES(automatico), "
+                "proxima_execucao = VALUES(proxima_execucao), visto_em = NOW()",
+                (job.nome, job.descricao[:200], job.agenda_texto()[:120],
+                 int(job.automatico), self.proxima(job.nome)))
+
+    # ----------------------------------------------------------- execução
+    def executar(self, nome, origem='agendador', execucao_id=None):
+        """Roda o job uma vez e grava o histórico. Devolve o status."""
+        job = self.jobs.get(nome)
+        if job is None:
+            self._fechar(execucao_id, nome,
+                         resultado('erro', detalhe='job desconhecido: %s' % nome), 0)
+            return 'erro'
+        if not job.rodando.acquire(blocking=False):
+            self.app.logger.info("[agendador] %s ainda rodando; pedido (%s) pulado.", nome, origem)
+            r = resultado('pulado', detalhe='rodada anterior ainda em andamento')
+            self._fechar(execucao_id or self._abrir(nome, origem), nome, r, 0)
+            return 'pulado'
+        try:
+            if execucao_id is None:
+                execucao_id = self._abrir(nome, origem)
+            t0 = time.perf_counter()
+            try:
+                r = job.fn(self.app, origem) or resultado()
+            except Exception as exc:
+                self.app.logger.exception("[agendador] %s falhou.", nome)
+                r = resultado('erro', detalhe='%s: %s' % (type(exc).__name__, exc))
+            ms = int((time.perf_counter() - t0) * 1000)
+            self._fechar(execucao_id, nome, r, ms)
+            if origem != 'agendador' or r.get('linhas'):
+                self.app.logger.info("[agendador] %s (%s): %s em %d ms, %s linha(s).",
+                                     nome, origem, r['status'], ms, r.get('linhas'))
+            return r['status']
+        finally:
+            job.rodando.release()
+
+    def processar_fila(self):
+        """Reivindica os pedidos 'fila' e roda cada um numa thread. Devolve
+        as threads (o laço não espera por elas)."""
+        conn = self._conectar()
+        cur = conn.cursor()
+        threads = []
+        try:
+            cur.execute("SELECT id, job, origem FROM agendador_execucoes "
+                        "WHERE status = 'fila' ORDER BY id LIMIT 20")
+            for execucao_id, nome, origem in cur.fetchall():
+                cur.execute(
+                    "UPDATE agendador_execucoes SET status = 'rodando', inicio = NOW(), "
+                    "processo = %s WHERE id = %s AND status = 'fila'", (PROCESSO, execucao_id))
+                conn.commit()
+                if cur.rowcount != 1:
+                    continue        # outro processo levou
+                t = threading.Thread(target=self.executar, args=(nome, origem, execucao_id),
+                                     name='agendador-%s' % nome, daemon=True)
+                t.start()
+                threads.append(t)
+        finally:
+            cur.close()
+            conn.close()
+        return threads
+
+    def _encerrar_orfas(self):
+        """Rodadas 'rodando' de um processo que morreu no meio (deploy,
+        OOM): só no processo dedicado. Num deploy o processo antigo pode
+        ainda estar de pé terminando as dele -- por isso só fecha as que
+        estão sem batimento (visto_em, ou o início) há mais de VIVO_SEG."""
+        self._gravar(
+            "UPDATE agendador_execucoes SET status = 'erro', fim = NOW(), "
+            "detalhe = 'processo do agendador reiniciado durante a rodada' "
+            "WHERE status = 'rodando' AND (processo IS NULL OR processo <> %s) "
+            "AND (COALESCE(visto_em, inicio) IS NULL "
+            "     OR COALESCE(visto_em, inicio) < NOW() - INTERVAL %s SECOND)",
+            (PROCESSO, VIVO_SEG))
+
+    # ---------------------------------------------------------- ciclo de vida
+    def iniciar(self):
+        """Liga o APScheduler com os jobs automáticos. Não bloqueia."""
+        from apscheduler.schedulers.background import BackgroundScheduler
+
+        tz = fuso()
+        self._sched = BackgroundScheduler(daemon=True, timezone=tz)
+        for job in self.jobs.values():
+            if not job.automatico:
+                continue
+            self._sched.add_job(
+                self.executar, args=(job.nome,), trigger=job.gatilho, id=job.nome,
+                max_instances=1, coalesce=True, misfire_grace_time=job.misfire,
+                **(dict(job.agenda, timezone=tz) if job.gatilho == 'cron' else job.agenda),
+            )
+        self._sched.start()
+        for job in self.jobs.values():
+            self.app.logger.info("[agendador] %-22s %s (próxima: %s)",
+                                 job.nome, job.agenda_texto(), self.proxima(job.nome))
+        self.batimento()
+
+    def laco(self):
+        """Lê a fila até parar(); batimento a cada BATIMENTO_SEG."""
+        ultimo = time.monotonic()
+        while not self._parar.wait(FILA_SEG):
+            try:
+                self.processar_fila()
+            except Exception:
+                self.app.logger.warning("[agendador] falha ao ler a fila.", exc_info=True)
+            if time.monotonic() - ultimo >= BATIMENTO_SEG:
+                self.batimento()
+                ultimo = time.monotonic()
+
+    def parar(self, *_):
+        self._parar.set()
+        if self._sched is not None:
+            self._sched.shutdown(wait=False)
+
+
+def iniciar_no_processo(app):
+    """AGENDADOR_NO_WEB=1: liga o agendador dentro deste worker web (cron +
+    fila numa thread daemon). O GET_LOCK de cada job segura os outros
+    workers."""
+    agendador = Agendador(app, registro())
+    agendador.iniciar()
+    threading.Thread(target=agendador.laco, name='agendador-fila', daemon=True).start()
+    return agendador
+
+
+def main():
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    # O processo do agendador não liga outro agendador dentro do create_app.
+    os.environ['AGENDADOR_PROCESSO'] = '1'
+    from app import app
+
+    agendador = Agendador(app, registro())
+    signal.signal(signal.SIGTERM, agendador.parar)
+    signal.signal(signal.SIGINT, agendador.parar)
+    agendador._encerrar_orfas()
+    agendador.iniciar()
+    app.logger.info("[agendador] processo %s no ar: %d job(s), fila a cada %.0fs.",
+                    PROCESSO, len(agendador.jobs), FILA_SEG)
+    agendador.laco()
+    app.logger.info("[agendador] processo %s encerrado.", PROCESSO)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+integrations/dashboard_scheduler.py
+===================================
+
+Job que mantém os blocos de KPI da home (tabela dashboard_metricas, ver
+utils/dashboard_metricas.py) em dia, rodado pelo processo do agendador
+(integrations/agendador.py).
+
+A cada N minutos (default 5) recalcula SÓ os blocos do mês corrente que
+estão sujos (invalidados por gravação em fretes/pedidos/vendas_posto/FIFO) ou
+vencidos (TTL) — incremental: bloco limpo e dentro do TTL não é tocado. Assim
+quem abre a home normalmente só lê a tabela. Na virada do mês o primeiro
+ciclo cria as linhas do mês novo.
+
+Concorrência: o agendador não sobrepõe duas rodadas; o GET_LOCK global no
+MySQL segura o resto (deploy, AGENDADOR_NO_WEB=1 com vários workers).
+
+Liga/desliga por env:
+    DASHBOARD_SCHED_ENABLED = '1' (default) | '0' para tirar do cron
+    DASHBOARD_SCHED_MINUTE  = minuto cron (default '*/5')
+"""
+import os
+
+from utils.db import get_db_connection
+from integrations.agendador import Job, resultado
+
+_LOCK_NAME = "dashboard_metricas"
+
+
+def _job(app, origem="agendador"):
+    logger = app.logger
+    conn = cur = None
+    got = 0
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute("SELECT GET_LOCK(%s, 0)", (_LOCK_NAME,))
+        row = cur.fetchone()
+        got = row[0] if row else 0
+        if got != 1:
+            logger.info("[dash_sched] outro worker já está atualizando; pulando.")
+            return resultado("pulado", detalhe="GET_LOCK negado")
+        with app.app_context():
+            from routes.bases import metricas_dashboard
+            _dados, recalculados = metricas_dashboard()
+        if recalculados:
+            logger.info("[dash_sched] blocos recalculados: %s", ", ".join(recalculados))
+        return resultado(linhas=len(recalculados), detalhe=", ".join(recalculados) or None)
+    finally:
+        try:
+            if got == 1 and cur is not None:
+                cur.execute("SELECT RELEASE_LOCK(%s)", (_LOCK_NAME,))
+                cur.fetchall()
+        except Exception:
+            pass
+        for c in (cur, conn):
+            try:
+                if c is not None:
+                    c.close()
+            except Exception:
+                pass
+
+
+def jobs():
+    """Job do dashboard para o registro do agendador."""
+    return [
+        Job("dashboard_metricas", _job, "cron",
+            minute=os.environ.get("DASHBOARD_SCHED_MINUTE", "*/5"),
+            descricao="recalcula os blocos de KPI sujos/vencidos da home",
+            automatico=os.environ.get("DASHBOARD_SCHED_ENABLED", "1") == "1",
+            misfire=120),
+    ]
@@ -1,5 +1,6 @@
 """
-Agendador in-process (APScheduler) da captura automatica de DFe.
+Jobs da captura automatica de DFe, rodados pelo processo do agendador
+(integrations/agendador.py; Procfile `scheduler:`).
 
 Roda A CADA 20 MINUTOS (horario de Brasilia) a captura em massa
 (scripts/captura_massa_dfe.py), respeitando a cota da SEFAZ. A cota da SEFAZ e
@@ -18,26 +19,35 @@ que ela abre (ate ~20 min depois), em vez de perde-la esperando 3h:
     aberta, disparamos e cada empresa/fase se auto-regula la dentro. Assim a
     NF-e travada (656 do SGA) de uma empresa nao arrasta o CT-e nem as outras.
 
-Concorrencia (gunicorn --workers 2):
-  cada worker cria o seu proprio scheduler, entao o job usa um LOCK global no
-  MySQL (GET_LOCK) para garantir que APENAS UMA execucao rode por vez em todo o
-  deploy. O worker que nao pega o lock so registra e sai. Assim nunca ha duas
-  consultas simultaneas a SEFAZ (o que dispararia 656).
+Concorrencia:
+  um processo so roda os jobs, e o agendador nunca sobrepoe duas rodadas do
+  mesmo job. O job ainda usa um LOCK global no MySQL (GET_LOCK) para que
+  APENAS UMA execucao rode por vez em todo o deploy (processo antigo ainda de
+  pe durante o deploy, AGENDADOR_NO_WEB=1 com varios workers). Quem nao pega
+  o lock so registra e sai. Assim nunca ha duas consultas simultaneas a SEFAZ
+  (o que dispararia 656).
 
-Liga/desliga por env (no servico web do Railway):
-  DFE_SCHED_ENABLED = '1' (default) | '0' para desligar
+O botao "Capturar agora" (POST /dfe/capturar-agora) enfileira o job
+'dfe_captura' com origem 'manual' (agendador.enfileirar).
+
+Liga/desliga por env (no servico do agendador):
+  DFE_SCHED_ENABLED = '1' (default) | '0' para tirar do cron (o botao segue
+                      funcionando)
   DFE_SCHED_HOURS   = horas do disparo em cron (default '*' = toda hora)
   DFE_SCHED_MINUTE  = minuto do disparo em cron (default '*/20' = a cada 20 min)
+  DFE_XML_UPLOAD_INTERVALO_MIN = de quantos em quantos minutos drenar a fila de
+                      XML para o Dropbox (dfe_xml_outbox; default 5)
 """
 import os
 import sys
 import subprocess
-import threading
 
 import mysql.connector
 
 from utils.db import CONNECTION_PARAMS
 from integrations import dfe_log
+from integrations import dfe_xml_spool
+from integrations.agendador import Job, resultado
 
 _LOCK_NAME = 'dfe_captura'
 _SUBPROC_TIMEOUT = 20 * 60  # 20 min (o script tem teto de 40 lotes + pausas de 20s)
@@ -45,9 +55,6 @@ _SUBPROC_TIMEOUT = 20 * 60  # 20 min (o script tem teto de 40 lotes + pausas de
 _RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 _SCRIPT = os.path.join(_RAIZ, 'scripts', 'captura_massa_dfe.py')
 
-_started = False
-_started_lock = threading.Lock()
-
 
 def _conn_direta():
     """Conexao DEDICADA (fora do pool) para segurar o GET_LOCK durante toda a
@@ -95,10 +102,11 @@ def _estado_cota(cur):
 
 
 def _job(app, origem='agendador'):
-    """Executado pelo scheduler. Garantidamente unico por deploy via GET_LOCK.
+    """Executado pelo agendador. Garantidamente unico por deploy via GET_LOCK.
 
     origem ('agendador'|'manual') so rotula o log e e repassada ao subprocess
-    via DFE_ORIGEM, para dfe_consulta_log saber QUEM disparou cada rodada."""
+    via DFE_ORIGEM, para dfe_consulta_log saber QUEM disparou cada rodada.
+    Devolve agendador.resultado (o historico do agendador)."""
     logger = app.logger
     conn = cur = None
     got = 0
@@ -115,7 +123,7 @@ def _job(app, origem='agendador'):
             dfe_log.registrar(
                 cur, origem, 'pulado_lock',
                 detalhe='outro worker/deploy ja estava capturando (GET_LOCK negado)')
-            return
+            return resultado('pulado', detalhe='GET_LOCK negado (outra captura rodando)')
 
         # Pre-check de cota MULTI-EMPRESA (opcao ii estendida): so pula o ciclo
         # se TODAS as empresas ativas/automaticas estao de castigo por 656 nas
@@ -131,7 +139,7 @@ def _job(app, origem='agendador'):
                 cur, origem, 'pulado_cota',
                 detalhe='todas as %s empresa(s) ativas/automaticas bloqueadas nas duas '
                         'fases; nem disparou a captura' % total)
-            return
+            return resultado('pulado', detalhe='todas as %s empresa(s) de castigo (656)' % total)
 
         logger.info("[dfe_sched] iniciando captura em massa (%s)...", _SCRIPT)
         env = dict(os.environ, DFE_ORIGEM=origem)
@@ -151,6 +159,8 @@ def _job(app, origem='agendador'):
                 cur, origem, 'erro',
                 detalhe='captura saiu com rc=%s; stderr: %s'
                         % (res.returncode, (res.stderr or '').strip()[-200:]))
+            return resultado('erro', detalhe='captura saiu com rc=%s' % res.returncode)
+        return resultado()
     except subprocess.TimeoutExpired:
         logger.warning("[dfe_sched] captura excedeu %ss; sera retomada no proximo ciclo.",
                        _SUBPROC_TIMEOUT)
@@ -158,11 +168,13 @@ def _job(app, origem='agendador'):
             dfe_log.registrar(cur, origem, 'erro',
                               detalhe='captura excedeu o timeout de %ss e foi morta'
                                       % _SUBPROC_TIMEOUT)
+        return resultado('erro', detalhe='timeout de %ss' % _SUBPROC_TIMEOUT)
     except Exception as exc:
         logger.exception("[dfe_sched] falha no job de captura.")
         if cur is not None:
             dfe_log.registrar(cur, origem, 'erro',
                               detalhe='%s: %s' % (type(exc).__name__, exc))
+        return resultado('erro', detalhe='%s: %s' % (type(exc).__name__, exc))
     finally:
         try:
             if got == 1 and cur is not None:
@@ -178,76 +190,43 @@ def _job(app, origem='agendador'):
                 pass
 
 
-def iniciar_scheduler(app):
-    """Liga o APScheduler (idempotente por processo). Chamar em create_app()."""
-    global _started
-
-    if os.environ.get('DFE_SCHED_ENABLED', '1') != '1':
-        app.logger.info("[dfe_sched] desabilitado (DFE_SCHED_ENABLED != '1').")
-        return
-
-    with _started_lock:
-        if _started:
-            return
-        try:
-            from apscheduler.schedulers.background import BackgroundScheduler
-            from apscheduler.triggers.cron import CronTrigger
-        except Exception:
-            app.logger.warning("[dfe_sched] APScheduler nao instalado; scheduler NAO iniciado.")
-            return
-
-        # Minuto do disparo em cron. Aceita expressao ('*/20', '5,25,45'...),
-        # nao so um inteiro fixo -- por isso repassamos a string crua ao
-        # CronTrigger. Default '*/20' = a cada 20 min.
-        minuto = os.environ.get('DFE_SCHED_MINUTE', '*/20')
-
-        # Horas do disparo em cron; default '*' (toda hora). Combinado com
-        # minuto '*/20', dispara a cada 20 min. Nao abusa da SEFAZ: o proprio
-        # ciclo se auto-regula -- apos um 656 grava proximo_permitido=+1h e a
-        # pre-checagem de cota nem dispara a captura enquanto o bloqueio vale.
-        # Assim tentamos de 20 em 20 min so para PEGAR a janela assim que ela
-        # abre (ate ~20 min depois), em vez de perde-la esperando 3h.
-        horas = os.environ.get('DFE_SCHED_HOURS', '*')
-
-        # Fuso de Brasilia: o container roda em UTC, entao fixamos o timezone
-        # para os horarios acima serem em horario de Brasilia (UTC-3).
-        # APScheduler 3.x so aceita timezones do pytz.
-        try:
-            import pytz
-            tz = pytz.timezone('America/Sao_Paulo')
-        except Exception:
-            tz = None
-            app.logger.warning(
-                "[dfe_sched] pytz indisponivel; usando fuso padrao do container (UTC)."
-            )
-
-        sched = BackgroundScheduler(daemon=True, timezone=tz)
-        sched.add_job(
-            lambda: _job(app),
-            trigger=CronTrigger(hour=horas, minute=minuto, timezone=tz),  # cada 20 min, BR
-            id='dfe_captura',
-            max_instances=1,
-            coalesce=True,
-            misfire_grace_time=300,
-        )
-        sched.start()
-        _started = True
-        app.logger.info(
-            "[dfe_sched] scheduler ligado: captura nas horas '%s' (America/Sao_Paulo), "
-            "minuto %s (lock global '%s').", horas, minuto, _LOCK_NAME,
-        )
-
-
-def disparar_captura_async(app):
-    """Dispara UMA captura AGORA, em background (mesma rotina do agendador).
-
-    Reutiliza _job(): GET_LOCK global (nao roda em paralelo com o agendador nem
-    com outro disparo), pre-check de proximo_permitido (nao consulta se a cota
-    ainda esta fechada) e subprocess com timeout. Retorna na hora; o trabalho
-    segue na thread daemon. Usado pela rota POST /dfe/capturar-agora, para forcar
-    uma coleta sem depender de terminal/CLI."""
-    t = threading.Thread(
-        target=_job, args=(app, 'manual'), name='dfe-captura-manual', daemon=True,
-    )
-    t.start()
-    return t
+def _job_outbox(app, origem='agendador'):
+    """Retentativas do upload de XML (dfe_xml_outbox). A captura ja drena a fila
+    enquanto roda; aqui sobe o que ficou para tras (Dropbox fora, prazo
+    estourado). GET_LOCK proprio: nunca dois drenadores ao mesmo tempo."""
+    stats = dfe_xml_spool.drenar_outbox(_conn_direta)
+    if not stats:
+        return resultado('pulado', detalhe='outro drenador com o lock')
+    if stats['enviados'] or stats['falhas']:
+        app.logger.info("[dfe_sched] XML para o Dropbox: %(enviados)s enviado(s), "
+                        "%(falhas)s falha(s), %(desistidos)s desistido(s).", stats)
+    return resultado(linhas=stats['enviados'],
+                     detalhe='%(falhas)s falha(s), %(desistidos)s desistido(s)' % stats
+                     if stats['falhas'] or stats['desistidos'] else None)
+
+
+def jobs():
+    """Jobs do DFe para o registro do agendador."""
+    # Minuto do disparo em cron. Aceita expressao ('*/20', '5,25,45'...),
+    # nao so um inteiro fixo -- por isso repassamos a string crua ao
+    # CronTrigger. Default '*/20' = a cada 20 min.
+    minuto = os.environ.get('DFE_SCHED_MINUTE', '*/20')
+
+    # Horas do disparo em cron; default '*' (toda hora). Combinado com
+    # minuto '*/20', dispara a cada 20 min. Nao abusa da SEFAZ: o proprio
+    # ciclo se auto-regula -- apos um 656 grava proximo_permitido=+1h e a
+    # pre-checagem de cota nem dispara a captura enquanto o bloqueio vale.
+    # Assim tentamos de 20 em 20 min so para PEGAR a janela assim que ela
+    # abre (ate ~20 min depois), em vez de perde-la esperando 3h.
+    horas = os.environ.get('DFE_SCHED_HOURS', '*')
+
+    automatico = os.environ.get('DFE_SCHED_ENABLED', '1') == '1'
+    return [
+        Job('dfe_captura', _job, 'cron', hour=horas, minute=minuto,
+            descricao='captura em massa de NF-e/CT-e na SEFAZ (lock %s)' % _LOCK_NAME,
+            automatico=automatico, misfire=300),
+        Job('dfe_xml_outbox', _job_outbox, 'interval',
+            minutes=int(os.environ.get('DFE_XML_UPLOAD_INTERVALO_MIN', '5')),
+            descricao='retentativas do upload de XML para o Dropbox',
+            automatico=automatico),
+    ]
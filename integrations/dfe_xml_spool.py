@@ -0,0 +1,383 @@
+# -*- coding: utf-8 -*-
+"""
+Spool LOCAL + outbox dos XML de DFe a caminho do Dropbox.
+
+Antes a captura subia cada XML (upload_xml) ANTES de gravar o documento: uma
+ida HTTPS ao Dropbox por nota/evento, dentro do prazo do subprocess de captura.
+Agora o caminho critico so grava em disco local:
+
+  1. guardar(): bytes do XML num diretorio ENDERECADO POR CONTEUDO
+     ({SPOOL_DIR}/{sha[:2]}/{sha}.xml, escrita atomica) + um ponteiro
+     pendentes/{sha1(caminho)}.ref -> sha, que e o que baixar_xml consulta;
+  2. linha em dfe_xml_outbox (caminho no Dropbox, sha256, tabela/chave do
+     documento e os PROPRIOS BYTES do XML em `conteudo`), gravada NA MESMA
+     transacao do documento;
+  3. drenar(): N workers (DFE_XML_UPLOAD_WORKERS) sobem os pendentes para o
+     Dropbox, com retentativa e espera crescente; ao terminar marcam a linha
+     como 'enviado', registram o xml_caminho no documento e limpam o spool.
+     Depois de DFE_XML_UPLOAD_TENTATIVAS falhas a linha vira 'falhou' (fica
+     no banco e no disco para reprocessar na mao).
+
+O disco e so o caminho rapido: a copia que vale ate o upload e a coluna
+`conteudo` (zerada quando a linha vira 'enviado'). Web e agendador rodam em
+containers separados e o disco do container some num redeploy, entao quem
+nao acha o arquivo le do banco. Sem arquivo E sem `conteudo` (linha antiga)
+a linha NAO desiste: continua pendente, com a espera maxima, e cada volta
+loga um erro para alguem olhar.
+
+Quem drena: a propria captura (UploaderEmSegundoPlano, em paralelo com as
+consultas a SEFAZ, com um ultimo esvaziamento no fim) e o agendador do app
+(dfe_scheduler, de tempos em tempos, para as retentativas). Um GET_LOCK no
+MySQL garante um drenador por vez em todo o deploy.
+
+Como dfe_log, serve aos DOIS drivers (pymysql na captura, mysql-connector no
+agendador): SQL com %s e linhas lidas pelo cursor.description.
+"""
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+logger = logging.getLogger(__name__)
+
+_RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SPOOL_DIR = os.environ.get('DFE_XML_SPOOL_DIR') or os.path.join(_RAIZ, 'spool', 'dfe_xml')
+WORKERS = max(1, int(os.environ.get('DFE_XML_UPLOAD_WORKERS', '4')))
+MAX_TENTATIVAS = max(1, int(os.environ.get('DFE_XML_UPLOAD_TENTATIVAS', '8')))
+
+_LOCK_NAME = 'dfe_xml_outbox'
+
+# Onde registrar o xml_caminho quando o upload termina: tabela -> coluna-chave.
+ALVOS = {'dfe_documentos': 'chave', 'dfe_eventos': 'chave_evento'}
+
+DDL_OUTBOX = """
+CREATE TABLE IF NOT EXISTS dfe_xml_outbox (
+    id                BIGINT AUTO_INCREMENT PRIMARY KEY,
+    caminho           VARCHAR(300) NOT NULL,
+    sha256            CHAR(64)     NOT NULL,
+    tamanho           INT          NOT NULL,
+    tabela            VARCHAR(20)  NOT NULL,
+    chave             VARCHAR(60)  NOT NULL,
+    status            VARCHAR(10)  NOT NULL DEFAULT 'pendente',
+    tentativas        INT          NOT NULL DEFAULT 0,
+    proxima_tentativa DATETIME     NULL,
+    ultimo_erro       VARCHAR(300) NULL,
+    conteudo          MEDIUMBLOB   NULL,
+    criado_em         TIMESTAMP    NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    enviado_em        DATETIME     NULL,
+    UNIQUE KEY uk_caminho (caminho),
+    KEY ix_status (status, proxima_tentativa)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+"""
+
+# Reenfileirar o mesmo caminho (XML recapturado) volta a linha para pendente.
+SQL_ENFILEIRAR = (
+    "INSERT INTO dfe_xml_outbox (caminho, sha256, tamanho, tabela, chave, conteudo, status) "
+    "VALUES (%s,%s,%s,%s,%s,%s,'pendente') "
+    "ON DUPLICATE KEY UPDATE "
+    "  sha256=VALUES(sha256), tamanho=VALUES(tamanho), tabela=VALUES(tabela), "
+    "  chave=VALUES(chave), conteudo=VALUES(conteudo), status='pendente', tentativas=0, "
+    "  proxima_tentativa=NULL, ultimo_erro=NULL, enviado_em=NULL"
+)
+
+
+_tabela_ok = False
+
+
+def garantir_tabela(cur):
+    """CREATE TABLE IF NOT EXISTS da outbox + coluna `conteudo` (idempotente)."""
+    cur.execute(DDL_OUTBOX)
+    cur.execute(
+        "SELECT COUNT(*) AS n FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'dfe_xml_outbox' "
+        "AND COLUMN_NAME = 'conteudo'")
+    row = cur.fetchone()
+    if not (row['n'] if isinstance(row, dict) else row[0]):
+        cur.execute("ALTER TABLE dfe_xml_outbox ADD COLUMN conteudo MEDIUMBLOB NULL "
+                    "AFTER ultimo_erro")
+
+
+# ==========================================================================
+# Spool em disco
+# ==========================================================================
+def _arquivo(sha):
+    return os.path.join(SPOOL_DIR, sha[:2], sha + '.xml')
+
+
+def _ponteiro(caminho):
+    nome = hashlib.sha1(caminho.encode('utf-8')).hexdigest() + '.ref'
+    return os.path.join(SPOOL_DIR, 'pendentes', nome)
+
+
+def _gravar_atomico(destino, dados):
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    tmp = '%s.%d.%d.tmp' % (destino, os.getpid(), threading.get_ident())
+    with open(tmp, 'wb') as f:
+        f.write(dados)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, destino)
+
+
+def guardar(caminho, conteudo):
+    """Guarda o XML no spool e aponta `caminho` para ele. Retorna (sha256, tamanho)."""
+    if isinstance(conteudo, str):
+        conteudo = conteudo.encode('utf-8')
+    sha = hashlib.sha256(conteudo).hexdigest()
+    arquivo = _arquivo(sha)
+    if not os.path.exists(arquivo):
+        _gravar_atomico(arquivo, conteudo)
+    _gravar_atomico(_ponteiro(caminho), sha.encode('ascii'))
+    return sha, len(conteudo)
+
+
+def linha_outbox(caminho, sha, tamanho, tabela, chave, conteudo):
+    """Parametros de SQL_ENFILEIRAR (1 linha; serve para INSERT em bloco)."""
+    if tabela not in ALVOS:
+        raise ValueError('tabela sem xml_caminho: %r' % tabela)
+    if isinstance(conteudo, str):
+        conteudo = conteudo.encode('utf-8')
+    return caminho, sha, tamanho, tabela, chave, conteudo
+
+
+def enfileirar(cur, caminho, conteudo, tabela, chave):
+    """guardar() + linha na outbox. Sem commit: entra na transacao de quem chama."""
+    sha, tamanho = guardar(caminho, conteudo)
+    cur.execute(SQL_ENFILEIRAR,
+                linha_outbox(caminho, sha, tamanho, tabela, chave, conteudo))
+    return sha
+
+
+def _valor(row):
+    if row is None:
+        return None
+    return row.get('conteudo') if isinstance(row, dict) else row[0]
+
+
+def ler_pendente(caminho, conn=None):
+    """Bytes do XML se o upload de `caminho` ainda esta pendente, senao None.
+
+    Le do spool local; se o arquivo nao esta neste container e `conn` foi
+    passada, le a copia guardada em dfe_xml_outbox.conteudo."""
+    try:
+        with open(_ponteiro(caminho), 'rb') as f:
+            sha = f.read().decode('ascii').strip()
+        with open(_arquivo(sha), 'rb') as f:
+            return f.read()
+    except (OSError, ValueError):
+        pass
+    if conn is None:
+        return None
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            "SELECT conteudo FROM dfe_xml_outbox "
+            "WHERE caminho = %s AND status <> 'enviado'", (caminho,))
+        conteudo = _valor(cur.fetchone())
+    finally:
+        cur.close()
+    return bytes(conteudo) if conteudo is not None else None
+
+
+def _liberar(caminho, sha, apagar_arquivo):
+    """Tira o ponteiro (se ainda aponta para este sha) e, se ninguem mais usa, o XML."""
+    ponteiro = _ponteiro(caminho)
+    try:
+        with open(ponteiro, 'rb') as f:
+            if f.read().decode('ascii').strip() == sha:
+                os.remove(ponteiro)
+    except OSError:
+        pass
+    if apagar_arquivo:
+        try:
+            os.remove(_arquivo(sha))
+        except OSError:
+            pass
+
+
+# ==========================================================================
+# Outbox no MySQL
+# ==========================================================================
+def _espera(tentativas):
+    """Segundos ate a proxima tentativa: 30s, 1min, 2min... ate 1h."""
+    return min(3600, 30 * 2 ** max(0, tentativas - 1))
+
+
+class FilaOutbox:
+    """dfe_xml_outbox sobre uma conexao (pymysql ou mysql-connector)."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def _linhas(self, cur):
+        nomes = [c[0] for c in cur.description]
+        return [r if isinstance(r, dict) else dict(zip(nomes, r)) for r in cur.fetchall()]
+
+    def pegar(self, limite):
+        cur = self.conn.cursor()
+        try:
+            cur.execute(
+                "SELECT id, caminho, sha256, tabela, chave, tentativas, conteudo "
+                "FROM dfe_xml_outbox WHERE status = 'pendente' "
+                "AND (proxima_tentativa IS NULL OR proxima_tentativa <= NOW()) "
+                "ORDER BY id LIMIT %s", (limite,))
+            return self._linhas(cur)
+        finally:
+            cur.close()
+
+    def concluir(self, item):
+        """Marca enviado + registra o xml_caminho. True se o XML pode sair do spool."""
+        cur = self.conn.cursor()
+        try:
+            # sha256 na condicao: se o caminho foi reenfileirado com outro XML no
+            # meio do upload, a linha continua pendente para o conteudo novo.
+            cur.execute(
+                "UPDATE dfe_xml_outbox SET status='enviado', enviado_em=NOW(), "
+                "ultimo_erro=NULL, conteudo=NULL WHERE id = %s AND sha256 = %s",
+                (item['id'], item['sha256']))
+            coluna = ALVOS[item['tabela']]
+            cur.execute(
+                "UPDATE %s SET xml_caminho = %%s WHERE %s = %%s" % (item['tabela'], coluna),
+                (item['caminho'], item['chave']))
+            cur.execute(
+                "SELECT COUNT(*) AS n FROM dfe_xml_outbox "
+                "WHERE sha256 = %s AND status <> 'enviado'", (item['sha256'],))
+            ainda_usado = self._linhas(cur)[0]['n']
+            self.conn.commit()
+            return not ainda_usado
+        finally:
+            cur.close()
+
+    def adiar(self, item, erro, desistir=True):
+        """Conta a falha; agenda a proxima tentativa ou desiste. True se desistiu.
+
+        desistir=False: nunca vira 'falhou', so espera mais a cada volta."""
+        tentativas = int(item['tentativas'] or 0) + 1
+        desistiu = desistir and tentativas >= MAX_TENTATIVAS
+        cur = self.conn.cursor()
+        try:
+            cur.execute(
+                "UPDATE dfe_xml_outbox SET tentativas = %s, ultimo_erro = %s, "
+                "status = %s, proxima_tentativa = NOW() + INTERVAL %s SECOND "
+                "WHERE id = %s",
+                (tentativas, str(erro)[:300], 'falhou' if desistiu else 'pendente',
+                 _espera(tentativas), item['id']))
+            self.conn.commit()
+        finally:
+            cur.close()
+        return desistiu
+
+
+class ArquivoAusente(RuntimeError):
+    """Nem o spool nem dfe_xml_outbox.conteudo tem o XML (linha anterior a coluna)."""
+
+
+def _enviar_um(enviar, item):
+    try:
+        with open(_arquivo(item['sha256']), 'rb') as f:
+            conteudo = f.read()
+    except OSError as exc:
+        conteudo = item.get('conteudo')
+        if conteudo is None:
+            raise ArquivoAusente('XML fora do spool e sem copia no banco (%s): %s'
+                                 % (item['sha256'][:12], exc))
+    enviar(item['caminho'], bytes(conteudo))
+
+
+def drenar(fila, enviar, workers=WORKERS, lote=100, parar=None):
+    """Sobe os pendentes da `fila` com `workers` uploads simultaneos, ate nao
+    sobrar nenhum vencido (ou `parar` ser setado). Retorna as contagens."""
+    stats = {'enviados': 0, 'falhas': 0, 'desistidos': 0}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='dfe-xml-up') as pool:
+        while not (parar is not None and parar.is_set()):
+            itens = fila.pegar(lote)
+            if not itens:
+                break
+            futuros = {pool.submit(_enviar_um, enviar, it): it for it in itens}
+            for fut in as_completed(futuros):
+                it = futuros[fut]
+                exc = fut.exception()
+                if exc is None:
+                    _liberar(it['caminho'], it['sha256'], fila.concluir(it))
+                    stats['enviados'] += 1
+                    continue
+                stats['falhas'] += 1
+                ausente = isinstance(exc, ArquivoAusente)
+                if ausente:
+                    logger.error("dfe_xml_outbox %s: %s", it['caminho'], exc)
+                if fila.adiar(it, exc, desistir=not ausente):
+                    stats['desistidos'] += 1
+    return stats
+
+
+def drenar_outbox(conectar, enviar=None, workers=WORKERS, parar=None):
+    """Abre conexao propria, pega o GET_LOCK e drena a outbox.
+
+    Retorna as contagens de drenar(), ou None se outro processo ja estava
+    drenando. `enviar` default: dropbox_dfe.upload_xml."""
+    if enviar is None:
+        from integrations.dropbox_dfe import upload_xml as enviar
+    conn = conectar()
+    cur = conn.cursor()
+    got = 0
+    try:
+        cur.execute("SELECT GET_LOCK(%s, 0)", (_LOCK_NAME,))
+        row = cur.fetchone()
+        got = (list(row.values())[0] if isinstance(row, dict) else row[0]) if row else 0
+        if got != 1:
+            return None
+        global _tabela_ok
+        if not _tabela_ok:
+            garantir_tabela(cur)   # agendador antigo: coluna conteudo
+            _tabela_ok = True
+        return drenar(FilaOutbox(conn), enviar, workers=workers, parar=parar)
+    finally:
+        try:
+            if got == 1:
+                cur.execute("SELECT RELEASE_LOCK(%s)", (_LOCK_NAME,))
+                cur.fetchall()
+        except Exception:
+            pass
+        cur.close()
+        conn.close()
+
+
+class UploaderEmSegundoPlano(threading.Thread):
+    """Drena a outbox a cada `intervalo` s enquanto a captura roda.
+
+    encerrar(timeout) pede um ultimo esvaziamento e espera ate `timeout`; o que
+    nao subir a tempo fica pendente para o agendador do app."""
+
+    def __init__(self, conectar, enviar=None, workers=WORKERS, intervalo=2.0):
+        super().__init__(name='dfe-xml-uploader', daemon=True)
+        self.conectar = conectar
+        self.enviar = enviar
+        self.workers = workers
+        self.intervalo = intervalo
+        self.total = {'enviados': 0, 'falhas': 0, 'desistidos': 0}
+        self._fim = threading.Event()
+        self._abortar = threading.Event()
+
+    def run(self):
+        while True:
+            ultima = self._fim.is_set()
+            try:
+                stats = drenar_outbox(self.conectar, self.enviar, self.workers,
+                                      parar=self._abortar)
+                for k, v in (stats or {}).items():
+                    self.total[k] += v
+            except Exception as exc:
+                print(f"    (aviso: upload de XML pendente falhou: {exc})")
+            if ultima or self._abortar.is_set():
+                return
+            self._fim.wait(self.intervalo)
+
+    def encerrar(self, timeout):
+        self._fim.set()
+        self.join(max(0.0, timeout))
+        if self.is_alive():
+            self._abortar.set()
+            self.join(30)
+        return self.total
@@ -18,18 +18,12 @@ import os
 
 # Reaproveita a autenticação e a normalização de caminho do módulo OFX.
 # Import no topo para falhar cedo caso o módulo/base mude.
-from integrations.dropbox_ofx import _criar_dbx, _normalizar_caminho
+from integrations.dropbox_ofx import _DROPBOX_AVAILABLE, _criar_dbx, _normalizar_caminho
+from integrations.dfe_xml_spool import ler_pendente
 
-# WriteMode vem do pacote oficial dropbox. Import protegido: se o pacote não
-# estiver instalado, só quebra quando o upload for realmente chamado.
-try:
-    from dropbox.files import WriteMode
-    from dropbox.exceptions import ApiError
-    _DROPBOX_AVAILABLE = True
-except ImportError:
-    WriteMode = None
-    ApiError = Exception
-    _DROPBOX_AVAILABLE = False
+# WriteMode/ApiError vêm do pacote oficial dropbox, importado só dentro das
+# funções (ver integrations/dropbox_ofx.py): o SDK pesa no boot e só é usado
+# quando um arquivo sobe ou desce.
 
 
 def montar_caminho(cnpj: str, ano, mes, chave: str) -> str:
@@ -75,6 +69,8 @@ def upload_arquivo(caminho_dropbox: str, conteudo_bytes: bytes) -> dict:
         raise RuntimeError("upload_arquivo: conteudo_bytes é None")
     if isinstance(conteudo_bytes, str):
         conteudo_bytes = conteudo_bytes.encode('utf-8')
+    from dropbox.exceptions import ApiError
+    from dropbox.files import WriteMode
 
     caminho = _normalizar_caminho(caminho_dropbox)
 
@@ -97,7 +93,7 @@ def upload_xml(caminho_dropbox: str, conteudo_bytes: bytes) -> dict:
     return upload_arquivo(caminho_dropbox, conteudo_bytes)
 
 
-def baixar_xml(caminho_dropbox: str) -> bytes | None:
+def baixar_xml(caminho_dropbox: str, conn=None) -> bytes | None:
     """
     Lê de volta um XML já guardado. Usado para reprocessar nota antiga sem
     pedir nada à SEFAZ — foi assim que o vencimento das notas capturadas antes
@@ -106,11 +102,19 @@ def baixar_xml(caminho_dropbox: str) -> bytes | None:
     Devolve os bytes do XML, ou None se o arquivo não existe mais (a retenção
     é de 90 dias; sumir depois disso é o comportamento esperado, não erro).
     Qualquer outra falha do Dropbox levanta RuntimeError.
+
+    Enquanto o upload ainda está na fila (integrations/dfe_xml_spool), o XML
+    é lido do spool local ou, com `conn`, da cópia em dfe_xml_outbox — nem
+    chega a ir ao Dropbox.
     """
-    if not _DROPBOX_AVAILABLE:
-        raise RuntimeError('Pacote "dropbox" não instalado. Execute: pip install dropbox==12.0.2')
     if not caminho_dropbox:
         return None
+    pendente = ler_pendente(caminho_dropbox, conn)
+    if pendente is not None:
+        return pendente
+    if not _DROPBOX_AVAILABLE:
+        raise RuntimeError('Pacote "dropbox" não instalado. Execute: pip install dropbox==12.0.2')
+    from dropbox.exceptions import ApiError
 
     caminho = _normalizar_caminho(caminho_dropbox)
 
@@ -138,6 +142,7 @@ def apagar_xml(caminho_dropbox: str) -> bool:
         raise RuntimeError('Pacote "dropbox" não instalado. Execute: pip install dropbox==12.0.2')
     if not caminho_dropbox:
         raise RuntimeError("apagar_xml: caminho_dropbox vazio")
+    from dropbox.exceptions import ApiError
 
     caminho = _normalizar_caminho(caminho_dropbox)
 
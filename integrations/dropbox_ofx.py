@@ -23,17 +23,13 @@ Como gerar o DROPBOX_TOKEN:
   5. Copie o token e configure como variável de ambiente DROPBOX_TOKEN no Railway
 """
 
+import importlib.util
 import os
 import re
 
-# Importação lazy para não quebrar o app se o pacote não estiver instalado
-try:
-    import dropbox
-    from dropbox.exceptions import ApiError, AuthError
-    from dropbox.files import WriteMode
-    _DROPBOX_AVAILABLE = True
-except ImportError:
-    _DROPBOX_AVAILABLE = False
+# O SDK do dropbox leva ~170 ms para importar e só é usado quando alguém abre
+# o Dropbox: aqui só se verifica se está instalado; o import fica nas funções.
+_DROPBOX_AVAILABLE = importlib.util.find_spec('dropbox') is not None
 
 
 def _normalizar_caminho(caminho: str) -> str:
@@ -86,6 +82,7 @@ def _criar_dbx():
     """
     if not _DROPBOX_AVAILABLE:
         raise RuntimeError('Pacote "dropbox" não instalado. Execute: pip install dropbox')
+    import dropbox
 
     app_key     = os.environ.get('DROPBOX_APP_KEY', '').strip()
     app_secret  = os.environ.get('DROPBOX_APP_SECRET', '').strip()
@@ -144,6 +141,7 @@ def listar_arquivos_ofx() -> list:
     """
     if not _DROPBOX_AVAILABLE:
         raise RuntimeError('Pacote "dropbox" não instalado. Execute: pip install dropbox==12.0.2')
+    from dropbox.exceptions import ApiError, AuthError
 
     _, inbox, _ = _get_config()
 
@@ -206,6 +204,7 @@ def baixar_arquivo(nome_arquivo: str) -> str:
     """
     if not _DROPBOX_AVAILABLE:
         raise RuntimeError('Pacote "dropbox" não instalado.')
+    from dropbox.exceptions import ApiError
 
     nome_arquivo = os.path.basename(nome_arquivo)
     if not nome_arquivo.lower().endswith('.ofx'):
@@ -223,6 +222,40 @@ def baixar_arquivo(nome_arquivo: str) -> str:
     return response.content.decode('latin-1', errors='replace')
 
 
+def baixar_arquivo_stream(nome_arquivo: str, chunk_size: int = 64 * 1024):
+    """
+    Como `baixar_arquivo`, mas devolve um iterável de pedaços em bytes, sem
+    carregar o arquivo inteiro na memória. Para usar com
+    `integrations.ofx_parser.iter_transactions`.
+    """
+    if not _DROPBOX_AVAILABLE:
+        raise RuntimeError('Pacote "dropbox" não instalado.')
+    from dropbox.exceptions import ApiError
+
+    nome_arquivo = os.path.basename(nome_arquivo)
+    if not nome_arquivo.lower().endswith('.ofx'):
+        raise RuntimeError('Apenas arquivos .ofx são aceitos.')
+
+    _, inbox, _ = _get_config()
+    dbx = _criar_dbx()
+    caminho = f'{inbox}/{nome_arquivo}'
+
+    try:
+        _, response = dbx.files_download(caminho)
+    except ApiError as exc:
+        raise RuntimeError(f'Arquivo não encontrado no Dropbox: {caminho} — {exc}')
+
+    def _pedacos():
+        try:
+            for pedaco in response.iter_content(chunk_size=chunk_size):
+                if pedaco:
+                    yield pedaco
+        finally:
+            response.close()
+
+    return _pedacos()
+
+
 def extrair_acctid_ofx(nome_arquivo: str) -> str | None:
     """
     Baixa o arquivo OFX e retorna apenas os dígitos do ACCTID (número da conta)
@@ -18,12 +18,31 @@ tela chamam exatamente o mesmo código.
 
 Não duplica trabalho: só grava quando o status local está diferente do que a
 EFI diz.
+
+Custo
+-----
+As três situações (paid, settled, canceled) e as páginas de cada uma vão em
+paralelo, num `requests.Session` com pool de conexões e no máximo
+EFI_RECON_WORKERS (default 4) requisições em voo. O estado local sai de um
+`IN (...)` por lote, não de um SELECT por cobrança, e o detalhe (data do
+pagamento) das que mudaram também é buscado em paralelo.
+
+O agendador ainda guarda um cursor (`efi_sincronizacao`): a listagem da EFI
+filtra por data de CRIAÇÃO, não de alteração, então "o que mudou desde a
+última rodada" só pode ser cobrança que aqui ainda está em aberto. Entre
+varreduras completas (EFI_RECON_VARREDURA_HORAS, default 24) a janela começa
+na cobrança aberta mais antiga -- sem o piso de dias -- e, sem nenhuma em
+aberto, nem pergunta à EFI. Ver janela_agendador().
+
+EFI_API_BASE (env) aponta para outro servidor (scripts/fake_efi.py).
 """
 
 import os
-from datetime import date, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
 
 import requests
+from requests.adapters import HTTPAdapter
 
 from utils.boletos import (_ensure_credentials_from_env, _get_bearer_token,
                            fetch_charge)
@@ -32,6 +51,11 @@ from utils.db import get_db_connection
 _API_PROD = "https://cobrancas.api.efipay.com.br"
 _API_HOMOLOG = "https://cobrancas-h.api.efipay.com.br"
 
+WORKERS = max(1, int(os.environ.get("EFI_RECON_WORKERS", "4")))
+VARREDURA_HORAS = float(os.environ.get("EFI_RECON_VARREDURA_HORAS", "24"))
+_LOTE_IN = 500
+_CURSOR = "reconcilia"
+
 
 class ErroEfi(Exception):
     """Falha ao falar com a EFI. `codigo` e `detalhe` viram resposta HTTP na rota."""
@@ -122,17 +146,18 @@ def _data_pagamento(charge):
     return None
 
 
-def _data_pagamento_completa(charge, charge_id, cred, logger):
+def _data_pagamento_completa(charge, charge_id, cred, logger, detalhar=None):
     """A listagem da EFI não traz a data do pagamento — só o detalhe traz.
 
     Então, quando a listagem não sabe, buscamos o detalhe daquela cobrança. Só
     acontece para as que mudaram de status, não para a lista inteira.
+    `detalhar(charge_id)` troca o fetch_charge (reconciliar passa o da sessão).
     """
     quando = _data_pagamento(charge)
     if quando:
         return quando
     try:
-        detalhe = fetch_charge(cred, charge_id)
+        detalhe = (detalhar or (lambda cid: fetch_charge(cred, cid)))(charge_id)
         if isinstance(detalhe, dict):
             # O corpo útil às vezes vem embrulhado em "data".
             return _data_pagamento(detalhe.get("data") or detalhe)
@@ -142,19 +167,8 @@ def _data_pagamento_completa(charge, charge_id, cred, logger):
     return None
 
 
-def inicio_que_cobre_abertos(dias_min=45, dias_max=365):
-    """Desde quando perguntar à EFI, para não deixar boleto aberto fora do olhar.
-
-    Uma janela fixa de N dias parece razoável até um boleto passar do prazo: a
-    partir daí ele fica para trás da janela e o agendador nunca mais pergunta
-    por ele. Foi o que aconteceu com três boletos de maio e junho.
-
-    Então a janela se estica sozinha até alcançar a cobrança em aberto mais
-    antiga, com teto para a consulta não crescer sem fim. Quando tudo está em
-    dia, ela encolhe de volta para o mínimo.
-    """
-    piso = date.today() - timedelta(days=dias_min)
-    teto = date.today() - timedelta(days=dias_max)
+def _aberta_mais_antiga():
+    """data_emissao da cobrança em aberto mais antiga (ou None)."""
     conn = cur = None
     try:
         conn = get_db_connection()
@@ -164,9 +178,9 @@ def inicio_que_cobre_abertos(dias_min=45, dias_max=365):
             " WHERE status NOT IN ('pago','cancelado') AND charge_id IS NOT NULL"
         )
         row = cur.fetchone()
-        mais_antiga = row[0] if row else None
+        return row[0] if row else None
     except Exception:
-        mais_antiga = None
+        return None
     finally:
         for c in (cur, conn):
             try:
@@ -175,42 +189,173 @@ def inicio_que_cobre_abertos(dias_min=45, dias_max=365):
             except Exception:
                 pass
 
+
+def inicio_que_cobre_abertos(dias_min=45, dias_max=365):
+    """Desde quando perguntar à EFI, para não deixar boleto aberto fora do olhar.
+
+    Uma janela fixa de N dias parece razoável até um boleto passar do prazo: a
+    partir daí ele fica para trás da janela e o agendador nunca mais pergunta
+    por ele. Foi o que aconteceu com três boletos de maio e junho.
+
+    Então a janela se estica sozinha até alcançar a cobrança em aberto mais
+    antiga, com teto para a consulta não crescer sem fim. Quando tudo está em
+    dia, ela encolhe de volta para o mínimo.
+    """
+    piso = date.today() - timedelta(days=dias_min)
+    teto = date.today() - timedelta(days=dias_max)
+    mais_antiga = _aberta_mais_antiga()
     if not mais_antiga:
         return piso.isoformat()
     return max(min(mais_antiga, piso), teto).isoformat()
 
 
-def _buscar(base, headers, situacao, begin_date, end_date, logger):
-    """Todas as páginas de cobranças da EFI para uma situação."""
-    achados = []
-    page = 1
-    while True:
-        params = {
-            "charge_type": "billet",
-            "status": situacao,
-            "begin_date": begin_date,
-            "end_date": end_date,
-            "limit": 100,
-            "page": page,
-        }
-        r = requests.get(base + "/v1/charges", headers=headers, params=params, timeout=30)
-        if r.status_code != 200:
-            if logger:
-                logger.error("[efi_recon] %s ao buscar status=%s: %s",
-                             r.status_code, situacao, r.text[:600])
-            raise ErroEfi("EFI Pay retornou %s ao buscar status=%s." % (r.status_code, situacao),
-                          codigo=r.status_code, detalhe=r.text[:300])
-        dados = r.json()
-        pagina = dados.get("data") or []
-        achados.extend(pagina)
-        paginacao = dados.get("paginate") or {}
-        if page >= int(paginacao.get("totalPages") or 1) or not pagina:
-            break
-        page += 1
-    return achados
-
-
-def reconciliar(begin_date=None, end_date=None, config=None, logger=None):
+# ---------------------------------------------------------------- cursor
+def _ler_cursor(cur):
+    try:
+        cur.execute("SELECT ultima_varredura FROM efi_sincronizacao WHERE nome = %s",
+                    (_CURSOR,))
+        row = cur.fetchone()
+    except Exception:
+        return None      # tabela ainda não existe: varredura completa
+    return row[0] if row else None
+
+
+def janela_agendador(dias_min=45, dias_max=365):
+    """(begin_date, completa) da próxima rodada do agendador, ou None quando
+    não há nada que possa ter mudado.
+
+    Varredura completa (a janela de sempre, com piso de `dias_min`) na primeira
+    rodada e a cada VARREDURA_HORAS -- pega o que o incremental não vê
+    (cobrança sem data_emissao, cancelado que voltou a pago). Entre elas, só
+    desde a cobrança aberta mais antiga; sem nenhuma aberta, None.
+    """
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        ultima = _ler_cursor(cur)
+    finally:
+        cur.close()
+        conn.close()
+    if not ultima or datetime.now() - ultima >= timedelta(hours=VARREDURA_HORAS):
+        return inicio_que_cobre_abertos(dias_min, dias_max), True
+    mais_antiga = _aberta_mais_antiga()
+    if not mais_antiga:
+        return None
+    teto = date.today() - timedelta(days=dias_max)
+    return max(mais_antiga, teto).isoformat(), False
+
+
+def gravar_cursor(completa, resumo):
+    """Depois de uma rodada do agendador que deu certo."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            "INSERT INTO efi_sincronizacao (nome, ultima_execucao, ultima_varredura, "
+            "begin_date, total_efi) VALUES (%s, NOW(), IF(%s, NOW(), NULL), %s, %s) "
+            "ON DUPLICATE KEY UPDATE ultima_execucao = NOW(), "
+            "ultima_varredura = IF(%s, NOW(), ultima_varredura), "
+            "begin_date = VALUES(begin_date), total_efi = VALUES(total_efi)",
+            (_CURSOR, int(completa), resumo["periodo"]["begin_date"], resumo["total_efi"],
+             int(completa)),
+        )
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+
+
+# ------------------------------------------------------------------ HTTP
+def _base(cred):
+    return os.environ.get("EFI_API_BASE") or (
+        _API_HOMOLOG if cred.get("sandbox", True) else _API_PROD)
+
+
+def _sessao(workers):
+    """Session com pool do tamanho dos workers: as páginas reaproveitam a
+    conexão TLS em vez de abrir uma por requisição."""
+    sessao = requests.Session()
+    adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+    sessao.mount("https://", adaptador)
+    sessao.mount("http://", adaptador)
+    return sessao
+
+
+def _pagina(sessao, base, headers, situacao, begin_date, end_date, page, logger):
+    """Uma página de cobranças: (cobranças, total de páginas)."""
+    params = {
+        "charge_type": "billet",
+        "status": situacao,
+        "begin_date": begin_date,
+        "end_date": end_date,
+        "limit": 100,
+        "page": page,
+    }
+    r = sessao.get(base + "/v1/charges", headers=headers, params=params, timeout=30)
+    if r.status_code != 200:
+        if logger:
+            logger.error("[efi_recon] %s ao buscar status=%s: %s",
+                         r.status_code, situacao, r.text[:600])
+        raise ErroEfi("EFI Pay retornou %s ao buscar status=%s." % (r.status_code, situacao),
+                      codigo=r.status_code, detalhe=r.text[:300])
+    dados = r.json()
+    paginacao = dados.get("paginate") or {}
+    return dados.get("data") or [], int(paginacao.get("totalPages") or 1)
+
+
+def _buscar(pool, sessao, base, headers, situacoes, begin_date, end_date, logger):
+    """Todas as páginas de cada situação: {situacao: [cobranças]}, na ordem
+    das páginas. A página 1 de todas sai junto; sabendo o total de páginas,
+    as demais também."""
+    args = (begin_date, end_date)
+    primeiras = {s: pool.submit(_pagina, sessao, base, headers, s, *args, 1, logger)
+                 for s in situacoes}
+    paginas = {}
+    for s, fut in primeiras.items():
+        dados, total = fut.result()
+        resto = [pool.submit(_pagina, sessao, base, headers, s, *args, p, logger)
+                 for p in range(2, total + 1)] if dados else []
+        paginas[s] = (dados, resto)
+    return {s: dados + [c for fut in resto for c in fut.result()[0]]
+            for s, (dados, resto) in paginas.items()}
+
+
+def _detalhar_com(sessao, base, headers, cred):
+    """Detalhe da cobrança pela mesma sessão; se falhar, o fetch_charge de
+    sempre (SDK, Basic)."""
+    def detalhar(charge_id):
+        try:
+            r = sessao.get(base + "/v1/charge/%s" % charge_id, headers=headers, timeout=15)
+            if r.status_code == 200:
+                return r.json()
+        except requests.RequestException:
+            pass
+        return fetch_charge(cred, charge_id)
+    return detalhar
+
+
+# ------------------------------------------------------------------ banco
+def _charge_id(charge):
+    return str(charge.get("id") or charge.get("charge_id") or "").strip()
+
+
+def _status_locais(cur, charge_ids):
+    """{charge_id: status em minúsculas} das cobranças que existem aqui, em
+    lotes de IN (...). Com mais de uma linha por charge_id vale a primeira,
+    como o antigo `LIMIT 1`."""
+    ids = list(dict.fromkeys(charge_ids))
+    status = {}
+    for i in range(0, len(ids), _LOTE_IN):
+        lote = ids[i:i + _LOTE_IN]
+        cur.execute(
+            "SELECT charge_id, status FROM cobrancas WHERE charge_id IN (%s) ORDER BY id"
+            % ",".join(["%s"] * len(lote)), lote)
+        for row in cur.fetchall():
+            status.setdefault(str(row["charge_id"]).strip(), (row.get("status") or "").lower())
+    return status
+
+
+def reconciliar(begin_date=None, end_date=None, config=None, logger=None, workers=None):
     """Acerta `cobrancas` com o que a EFI diz. Devolve um resumo.
 
     Levanta ErroEfi quando não dá para falar com o provedor — quem chamou
@@ -218,9 +363,10 @@ def reconciliar(begin_date=None, end_date=None, config=None, logger=None):
     """
     begin_date = begin_date or (date.today() - timedelta(days=90)).isoformat()
     end_date = end_date or date.today().isoformat()
+    workers = workers or WORKERS
 
     cred = credenciais(config)
-    base = _API_HOMOLOG if cred.get("sandbox", True) else _API_PROD
+    base = _base(cred)
 
     token = _get_bearer_token(cred)
     if not token:
@@ -228,81 +374,94 @@ def reconciliar(begin_date=None, end_date=None, config=None, logger=None):
 
     headers = {"Authorization": "Bearer " + token, "Accept": "application/json"}
 
-    pagos = _buscar(base, headers, "paid", begin_date, end_date, logger)
-    liquidados = _buscar(base, headers, "settled", begin_date, end_date, logger)
-    cancelados = _buscar(base, headers, "canceled", begin_date, end_date, logger)
+    sessao = _sessao(workers)
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="efi-recon") as pool:
+            achados = _buscar(pool, sessao, base, headers, ("paid", "settled", "canceled"),
+                              begin_date, end_date, logger)
+            pagos, liquidados, cancelados = (achados["paid"], achados["settled"],
+                                             achados["canceled"])
 
-    if logger:
-        logger.info("[efi_recon] EFI: paid=%d settled=%d canceled=%d (%s -> %s)",
-                    len(pagos), len(liquidados), len(cancelados), begin_date, end_date)
+            if logger:
+                logger.info("[efi_recon] EFI: paid=%d settled=%d canceled=%d (%s -> %s)",
+                            len(pagos), len(liquidados), len(cancelados), begin_date, end_date)
 
-    atual_pagos, atual_cancelados, ja_corretos, nao_encontrados = [], [], [], []
-    sem_data = []   # baixados sem data: some do radar se ninguém contar
+            atual_pagos, atual_cancelados, ja_corretos, nao_encontrados = [], [], [], []
+            sem_data = []   # baixados sem data: some do radar se ninguém contar
 
-    conn = get_db_connection()
-    cur = conn.cursor(dictionary=True)
-    try:
-        for charge in (pagos + liquidados):
-            charge_id = str(charge.get("id") or charge.get("charge_id") or "").strip()
-            if not charge_id:
-                continue
-            cur.execute("SELECT id, status FROM cobrancas WHERE charge_id = %s LIMIT 1",
-                        (charge_id,))
-            row = cur.fetchone()
-            if not row:
-                nao_encontrados.append(charge_id)
-                continue
-            if (row.get("status") or "").lower() == "pago":
-                ja_corretos.append(charge_id)
-                continue
-            quando = _data_pagamento_completa(charge, charge_id, cred, logger)
-            if quando is None:
-                sem_data.append(charge_id)
-            cur.execute(
-                "UPDATE cobrancas SET status = 'pago', pago_via_provedor = 1,"
-                " data_pagamento = %s WHERE charge_id = %s",
-                (quando, charge_id),
-            )
-            conn.commit()
-            atual_pagos.append(charge_id)
-            if logger:
-                logger.info("[efi_recon] pago charge_id=%s", charge_id)
-
-        for charge in cancelados:
-            charge_id = str(charge.get("id") or charge.get("charge_id") or "").strip()
-            if not charge_id:
-                continue
-            cur.execute("SELECT id, status FROM cobrancas WHERE charge_id = %s LIMIT 1",
-                        (charge_id,))
-            row = cur.fetchone()
-            if not row:
-                nao_encontrados.append(charge_id)
-                continue
-            if (row.get("status") or "").lower() == "cancelado":
-                ja_corretos.append(charge_id)
-                continue
-            if (row.get("status") or "").lower() == "pago":
-                # Recebido por fora (Pix etc.): baixa manual + boleto
-                # cancelado na EFI de proposito. O cancelamento de la NAO
-                # pode apagar o pago daqui.
-                ja_corretos.append(charge_id)
-                continue
-            cur.execute(
-                "UPDATE cobrancas SET status = 'cancelado', data_cancelamento = NOW()"
-                " WHERE charge_id = %s",
-                (charge_id,),
-            )
-            conn.commit()
-            atual_cancelados.append(charge_id)
-            if logger:
-                logger.info("[efi_recon] cancelado charge_id=%s", charge_id)
-    finally:
-        for c in (cur, conn):
+            conn = get_db_connection()
+            cur = conn.cursor(dictionary=True)
             try:
-                if c is not None:
-                    c.close()
-            except Exception:
-                pass
+                status = _status_locais(
+                    cur, [_charge_id(c) for c in pagos + liquidados + cancelados if _charge_id(c)])
+
+                # Pagos/liquidados: decide quem muda, busca as datas em paralelo, grava.
+                mudar = []
+                for charge in (pagos + liquidados):
+                    charge_id = _charge_id(charge)
+                    if not charge_id:
+                        continue
+                    if charge_id not in status:
+                        nao_encontrados.append(charge_id)
+                        continue
+                    if status[charge_id] == "pago":
+                        ja_corretos.append(charge_id)
+                        continue
+                    status[charge_id] = "pago"   # repetida em settled conta como correta
+                    mudar.append((charge_id, charge))
+
+                detalhar = _detalhar_com(sessao, base, headers, cred)
+                datas = pool.map(
+                    lambda par: _data_pagamento_completa(par[1], par[0], cred, logger, detalhar),
+                    mudar)
+                for (charge_id, _charge), quando in zip(mudar, datas):
+                    if quando is None:
+                        sem_data.append(charge_id)
+                    cur.execute(
+                        "UPDATE cobrancas SET status = 'pago', pago_via_provedor = 1,"
+                        " data_pagamento = %s WHERE charge_id = %s",
+                        (quando, charge_id),
+                    )
+                    atual_pagos.append(charge_id)
+                    if logger:
+                        logger.info("[efi_recon] pago charge_id=%s", charge_id)
+                conn.commit()
+
+                for charge in cancelados:
+                    charge_id = _charge_id(charge)
+                    if not charge_id:
+                        continue
+                    if charge_id not in status:
+                        nao_encontrados.append(charge_id)
+                        continue
+                    if status[charge_id] == "cancelado":
+                        ja_corretos.append(charge_id)
+                        continue
+                    if status[charge_id] == "pago":
+                        # Recebido por fora (Pix etc.): baixa manual + boleto
+                        # cancelado na EFI de proposito. O cancelamento de la NAO
+                        # pode apagar o pago daqui.
+                        ja_corretos.append(charge_id)
+                        continue
+                    cur.execute(
+                        "UPDATE cobrancas SET status = 'cancelado', data_cancelamento = NOW()"
+                        " WHERE charge_id = %s",
+                        (charge_id,),
+                    )
+                    status[charge_id] = "cancelado"
+                    atual_cancelados.append(charge_id)
+                    if logger:
+                        logger.info("[efi_recon] cancelado charge_id=%s", charge_id)
+                conn.commit()
+            finally:
+                for c in (cur, conn):
+                    try:
+                        if c is not None:
+                            c.close()
+                    except Exception:
+                        pass
+    finally:
+        sessao.close()
 
     return {
         "periodo": {"begin_date": begin_date, "end_date": end_date},
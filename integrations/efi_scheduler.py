@@ -2,7 +2,8 @@
 integrations/efi_scheduler.py
 =============================
 
-Agendador in-process (APScheduler) da baixa automática dos boletos da EFI Pay.
+Job da baixa automática dos boletos da EFI Pay, rodado pelo processo do
+agendador (integrations/agendador.py).
 
 Por que ele existe
 ------------------
@@ -17,34 +18,32 @@ Este agendador é a rede de segurança. Ele pergunta à EFI, de tempos em tempos
 quais boletos foram pagos ou cancelados, e acerta o banco. Se o webhook estiver
 funcionando, ele não acha nada para fazer e sai barato.
 
-Concorrência (gunicorn --workers N): cada worker cria o seu scheduler, então o
-job usa GET_LOCK global no MySQL para que só UMA execução rode por vez.
+Concorrência: o agendador não sobrepõe duas rodadas; o GET_LOCK global no
+MySQL segura o resto (deploy, AGENDADOR_NO_WEB=1 com vários workers).
 
 Liga/desliga por env (configurar no Railway):
-    EFI_SCHED_ENABLED = '1' (default) | '0' para desligar
+    EFI_SCHED_ENABLED = '1' (default) | '0' para tirar do cron
     EFI_SCHED_MINUTE  = minuto cron (default '7,37' = duas vezes por hora)
     EFI_SCHED_HOURS   = horas cron (default '6-22' = ao longo do dia)
     EFI_SCHED_DIAS    = janela MINIMA em dias (default 45). A janela se estica
                         sozinha para alcançar o boleto em aberto mais antigo.
-
-Chamar iniciar_scheduler(app) dentro de create_app(), como já é feito com o
-dfe_scheduler e o els_scheduler.
+    EFI_RECON_VARREDURA_HORAS = de quanto em quanto tempo a rodada é completa
+                        (default 24); nas outras, só o que ainda está em aberto
+                        aqui (integrations/efi_reconcilia.janela_agendador).
 """
 
 import os
-import threading
 from datetime import date, timedelta
 
 from utils.db import get_db_connection
+from integrations.agendador import Job, resultado
 
 _LOCK_NAME = "efi_reconcilia"
-_started = False
-_started_lock = threading.Lock()
 
 
-def _job(app):
-    from integrations.efi_reconcilia import (ErroEfi, inicio_que_cobre_abertos,
-                                             reconciliar)
+def _job(app, origem="agendador"):
+    from integrations.efi_reconcilia import (ErroEfi, gravar_cursor, inicio_que_cobre_abertos,
+                                             janela_agendador, reconciliar)
 
     logger = app.logger
     conn = cur = None
@@ -57,30 +56,48 @@ def _job(app):
         got = row[0] if row else 0
         if got != 1:
             logger.info("[efi_sched] outro worker já está reconciliando; pulando.")
-            return
+            return resultado("pulado", detalhe="GET_LOCK negado")
 
         try:
             dias = int(os.environ.get("EFI_SCHED_DIAS", "45"))
         except ValueError:
             dias = 45
 
+        # Cursor (efi_sincronizacao): entre varreduras completas, só desde a
+        # cobrança aberta mais antiga; sem nenhuma aberta, nem pergunta à EFI.
+        # Pedido manual é sempre varredura completa.
+        if origem == "manual":
+            janela = (inicio_que_cobre_abertos(dias_min=dias), True)
+        else:
+            janela = janela_agendador(dias_min=dias)
+        if janela is None:
+            return resultado(linhas=0, detalhe="nenhuma cobrança em aberto")
+        inicio, completa = janela
+
         with app.app_context():
             resumo = reconciliar(
-                begin_date=inicio_que_cobre_abertos(dias_min=dias),
+                begin_date=inicio,
                 end_date=date.today().isoformat(),
                 config=app.config,
                 logger=logger,
             )
+        try:
+            gravar_cursor(completa, resumo)
+        except Exception:
+            logger.warning("[efi_sched] não gravou o cursor (efi_sincronizacao).", exc_info=True)
 
         # Só faz barulho quando mexeu em alguma coisa: rodando de meia em meia
         # hora, registrar "nada a fazer" enterraria o log.
         if resumo["atualizados_pagos"] or resumo["atualizados_cancelados"]:
             logger.info("[efi_sched] baixa automática: %d pago(s), %d cancelado(s).",
                         resumo["atualizados_pagos"], resumo["atualizados_cancelados"])
+        return resultado(linhas=resumo["atualizados_pagos"] + resumo["atualizados_cancelados"],
+                         detalhe="%s desde %s: %d pago(s), %d cancelado(s)" % (
+                             "varredura" if completa else "incremental", inicio,
+                             resumo["atualizados_pagos"], resumo["atualizados_cancelados"]))
     except ErroEfi as e:
         logger.warning("[efi_sched] EFI não respondeu: %s", e.mensagem)
-    except Exception:
-        logger.exception("[efi_sched] falha no job de reconciliação EFI.")
+        return resultado("erro", detalhe="EFI não respondeu: %s" % e.mensagem)
     finally:
         try:
             if got == 1 and cur is not None:
@@ -96,49 +113,13 @@ def _job(app):
                 pass
 
 
-def iniciar_scheduler(app):
-    """Liga o APScheduler da EFI (idempotente por processo). Chamar em create_app()."""
-    global _started
-    if os.environ.get("EFI_SCHED_ENABLED", "1") != "1":
-        app.logger.info("[efi_sched] desabilitado (EFI_SCHED_ENABLED != '1').")
-        return
-    with _started_lock:
-        if _started:
-            return
-        try:
-            from apscheduler.schedulers.background import BackgroundScheduler
-            from apscheduler.triggers.cron import CronTrigger
-        except Exception:
-            app.logger.warning("[efi_sched] APScheduler indisponível; scheduler NÃO iniciado.")
-            return
-
-        minuto = os.environ.get("EFI_SCHED_MINUTE", "7,37")
-        horas = os.environ.get("EFI_SCHED_HOURS", "6-22")
-        try:
-            import pytz
-            tz = pytz.timezone("America/Sao_Paulo")
-        except Exception:
-            tz = None
-
-        sched = BackgroundScheduler(daemon=True, timezone=tz)
-        sched.add_job(
-            lambda: _job(app),
-            trigger=CronTrigger(hour=horas, minute=minuto, timezone=tz),
-            id="efi_reconcilia",
-            max_instances=1,
-            coalesce=True,
-            misfire_grace_time=600,
-        )
-        sched.start()
-        _started = True
-        app.logger.info(
-            "[efi_sched] ligado: baixa automática nas horas '%s' minuto '%s' "
-            "(America/Sao_Paulo, lock '%s').", horas, minuto, _LOCK_NAME,
-        )
-
-
-def disparar_async(app):
-    """Dispara UMA reconciliação AGORA em background (mesma rotina do agendador)."""
-    t = threading.Thread(target=_job, args=(app,), name="efi-recon-manual", daemon=True)
-    t.start()
-    return t
+def jobs():
+    """Job da EFI para o registro do agendador."""
+    return [
+        Job("efi_reconcilia", _job, "cron",
+            hour=os.environ.get("EFI_SCHED_HOURS", "6-22"),
+            minute=os.environ.get("EFI_SCHED_MINUTE", "7,37"),
+            descricao="baixa automática dos boletos EFI (pagos/cancelados)",
+            automatico=os.environ.get("EFI_SCHED_ENABLED", "1") == "1",
+            misfire=600),
+    ]
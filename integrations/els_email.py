@@ -32,27 +32,50 @@ Configuração (variáveis de ambiente — configurar no Railway):
     ELS_CLIENTE_ID       (id do posto na tabela clientes — OBRIGATÓRIO)
     ELS_MATCH_TOLERANCIA (litros de tolerância no casamento de frete; default 500)
     ELS_MATCH_JANELA_DIAS(janela de dias p/ procurar o frete; default 5)
+    ELS_MAIL_IMAP_SSL    ('1' default; '0' = IMAP puro, p/ scripts/fake_imap.py)
+    ELS_IMAP_LOTE        (mensagens por UID FETCH; default 100)
+
+Volume
+------
+Com muita medição e descarga no dia, ou depois de a caixa ficar fora do ar um
+tempo, o custo era um round-trip de FETCH por mensagem, o HTMLParser em Python
+puro e um INSERT (mais um SELECT de todos os produtos) por tanque. Agora:
+
+  - o FETCH vai em conjuntos de UID ('101:180,185') de ELS_IMAP_LOTE
+    mensagens por comando, numa thread que já busca o lote seguinte enquanto
+    o atual é decodificado, parseado e gravado (_em_paralelo);
+  - cada lote grava com executemany (leituras e descargas) e um único
+    `chave IN (...)` para a idempotência; se o lote falhar, cai no caminho
+    antigo, mensagem a mensagem, para só a ruim ficar de fora;
+  - processar() guarda o maior UID já resolvido (tabela els_sincronizacao) e
+    a próxima busca é `UID n+1:*`, sem reescanear a janela SENTSINCE. UID que
+    falhou segura o cursor, então continua sendo relido até gravar.
 """
 
 from __future__ import annotations
 
 import email
+import html as html_mod
 import imaplib
 import logging
 import os
+import queue
 import re
+import threading
 import unicodedata
 from dataclasses import dataclass, field
 from datetime import date, datetime, timedelta
 from email.header import decode_header, make_header
-from html.parser import HTMLParser
 from typing import Optional
 
 from utils.db import get_db_connection
+from utils.saldo_tempo_real import notificar as notificar_saldo
+from utils.schema_registry import garantia
 
 _log = logging.getLogger(__name__)
 
 REMETENTE_PADRAO = "notificacao@sistemaels.com.br"
+LOTE_FETCH = max(1, int(os.environ.get("ELS_IMAP_LOTE", "100")))
 
 
 # ===========================================================================
@@ -75,6 +98,7 @@ def _cliente_id() -> Optional[int]:
 # Criação idempotente das tabelas (padrão de routes/descargas.py)
 # ===========================================================================
 
+@garantia
 def ensure_tables():
     """Cria leitura_tanque_diaria e descargas_pendentes se não existirem."""
     ddl_leitura = """
@@ -130,6 +154,7 @@ def ensure_tables():
         conn.commit()
     except Exception:
         _log.warning("[els] falha ao criar tabelas ELS (não crítico).", exc_info=True)
+        return False
     finally:
         cur.close()
         conn.close()
@@ -177,30 +202,29 @@ class Descarga:
 # Parsing (validado contra e-mails reais do ELS)
 # ===========================================================================
 
-class _HTMLToText(HTMLParser):
-    def __init__(self):
-        super().__init__()
-        self._parts = []
+# Mesma saída do antigo _HTMLToText (HTMLParser): quebra de linha na abertura
+# de br/p/div/tr/li e no fechamento de p/div/tr/li, comentário e declaração
+# somem, entidades viram texto. Um re.sub no lugar do parser em Python puro.
+_TAG = re.compile(r"<!--.*?-->|<[!?][^>]*>"
+                  r"|<(/?)([a-zA-Z][^\s/>]*)(?:\"[^\"]*\"|'[^']*'|[^'\">])*?(/?)>",
+                  re.DOTALL)
+_QUEBRA_ABRE = frozenset(("br", "p", "div", "tr", "li"))
+_QUEBRA_FECHA = frozenset(("p", "div", "tr", "li"))
 
-    def handle_data(self, data):
-        self._parts.append(data)
 
-    def handle_starttag(self, tag, attrs):
-        if tag in ("br", "p", "div", "tr", "li"):
-            self._parts.append("\n")
-
-    def handle_endtag(self, tag):
-        if tag in ("p", "div", "tr", "li"):
-            self._parts.append("\n")
-
-    def get_text(self):
-        return "".join(self._parts)
+def _quebra(m):
+    fecha, nome, auto = m.group(1), m.group(2), m.group(3)
+    if nome is None:
+        return ""
+    nome = nome.lower()
+    if fecha:
+        return "\n" if nome in _QUEBRA_FECHA else ""
+    n = "\n" if nome in _QUEBRA_ABRE else ""
+    return n + "\n" if auto and nome in _QUEBRA_FECHA else n
 
 
 def _html_txt(html):
-    p = _HTMLToText()
-    p.feed(html)
-    return p.get_text()
+    return html_mod.unescape(_TAG.sub(_quebra, html))
 
 
 def num_br(valor):
@@ -342,81 +366,257 @@ def _texto_msg(msg):
     return _html_txt(html) if html else ""
 
 
-def _buscar(cfg_dias=1, apenas_nao_lidos=True):
-    """Retorna [(uid, assunto, texto)] das mensagens do ELS.
-
-    NAO marca como lida: a marcacao e feita por marcar_lidos(), somente apos a
-    gravacao ter dado commit com sucesso. Assim um erro de gravacao NUNCA
-    consome o e-mail em silencio (ele fica nao-lido e e reprocessado).
-    Usa UID (identificador estavel) para casar com marcar_lidos().
-    """
-    host = _cfg("ELS_MAIL_IMAP_HOST", "imap.titan.email")
-    port = int(_cfg("ELS_MAIL_IMAP_PORT", "993"))
+def _conectar():
+    """IMAP logado na caixa do ELS, ou None sem credenciais."""
     user = _cfg("ELS_MAIL_USER")
     pwd = _cfg("ELS_MAIL_PASSWORD")
-    mailbox = _cfg("ELS_MAIL_MAILBOX", "INBOX")
-    remetente = _cfg("ELS_REMETENTE", REMETENTE_PADRAO)
     if not user or not pwd:
         _log.warning("[els] ELS_MAIL_USER / ELS_MAIL_PASSWORD não configurados.")
-        return []
+        return None
+    host = _cfg("ELS_MAIL_IMAP_HOST", "imap.titan.email")
+    port = int(_cfg("ELS_MAIL_IMAP_PORT", "993"))
+    classe = imaplib.IMAP4_SSL if _cfg("ELS_MAIL_IMAP_SSL", "1") != "0" else imaplib.IMAP4
+    M = classe(host, port)
+    try:
+        M.login(user, pwd)
+    except Exception:
+        M.logout()
+        raise
+    return M
 
-    since = (date.today() - timedelta(days=cfg_dias)).strftime("%d-%b-%Y")
-    partes = [f'FROM "{remetente}"', f'SENTSINCE {since}']
-    if apenas_nao_lidos:
-        partes.append("UNSEEN")
-    criterio = "(" + " ".join(partes) + ")"
 
-    M = imaplib.IMAP4_SSL(host, port)
-    out = []
+def _sair(M):
     try:
-        M.login(user, pwd)
-        M.select(mailbox)
-        typ, dados = M.uid("SEARCH", None, criterio)
+        M.close()
+    except Exception:
+        pass
+    M.logout()
+
+
+def _conjunto(uids):
+    """[101, 102, 103, 107] -> '101:103,107' (UID set do IMAP)."""
+    faixas = []
+    for u in sorted(int(x) for x in uids):
+        if faixas and u == faixas[-1][1] + 1:
+            faixas[-1][1] = u
+        else:
+            faixas.append([u, u])
+    return ",".join(str(a) if a == b else "%d:%d" % (a, b) for a, b in faixas)
+
+
+def _fatias(seq, n):
+    for i in range(0, len(seq), n):
+        yield seq[i:i + n]
+
+
+_UID_RESP = re.compile(rb"\bUID (\d+)")
+
+
+def _lotes_imap(cfg_dias, apenas_nao_lidos, cursor, estado, tamanho):
+    """Gera listas [(uid, bytes)] com UM `UID FETCH <conjunto>` por lote.
+
+    `cursor` = (uidvalidity, ultimo_uid) de els_sincronizacao: valendo, a
+    busca é só `UID ultimo+1:*` (sem SENTSINCE). `estado` recebe uidvalidity
+    uidnext e os UIDs que a busca devolveu, para processar() mover o cursor.
+    """
+    M = _conectar()
+    if M is None:
+        return
+    try:
+        M.select(_cfg("ELS_MAIL_MAILBOX", "INBOX"))
+        validade = (M.response("UIDVALIDITY")[1] or [None])[0]
+        validade = int(validade) if validade else None
+        estado["uidvalidity"] = validade
+        proximo = (M.response("UIDNEXT")[1] or [None])[0]
+        estado["uidnext"] = int(proximo) if proximo else None
+
+        remetente = _cfg("ELS_REMETENTE", REMETENTE_PADRAO)
+        partes = [f'FROM "{remetente}"']
+        desde = None
+        if cursor and validade is not None and cursor[0] == validade:
+            desde = int(cursor[1])
+            partes.insert(0, f"UID {desde + 1}:*")
+        else:
+            since = (date.today() - timedelta(days=cfg_dias)).strftime("%d-%b-%Y")
+            partes.append(f"SENTSINCE {since}")
+        if apenas_nao_lidos:
+            partes.append("UNSEEN")
+        typ, dados = M.uid("SEARCH", None, "(" + " ".join(partes) + ")")
         if typ != "OK" or not dados or not dados[0]:
-            return out
-        for uid in dados[0].split():
+            estado["uids"] = []
+            return
+        # 'n:*' sempre casa a ultima mensagem, mesmo com UID <= n.
+        uids = sorted(u for u in (int(x) for x in dados[0].split())
+                      if desde is None or u > desde)
+        estado["uids"] = uids
+
+        for fatia in _fatias(uids, tamanho):
             # BODY.PEEK[] traz a mensagem inteira SEM setar \Seen. Um FETCH
             # RFC822/BODY[] marcaria o e-mail como lido como efeito colateral,
             # sabotando a idempotencia (a marcacao e feita so por marcar_lidos,
             # apos gravar com sucesso).
-            typ, raw = M.uid("FETCH", uid, "(BODY.PEEK[])")
-            if typ != "OK" or not raw or raw[0] is None:
+            typ, raw = M.uid("FETCH", _conjunto(fatia), "(BODY.PEEK[])")
+            if typ != "OK" or not raw:
                 continue
-            msg = email.message_from_bytes(raw[0][1])
-            uid_str = uid.decode() if isinstance(uid, bytes) else str(uid)
-            out.append((uid_str, _decode(msg.get("Subject", "")), _texto_msg(msg)))
-        return out
+            lote = []
+            for parte in raw:
+                # tupla (b'7 (UID 107 BODY[] {n}', corpo); o resto e b')' ou
+                # FETCH de FLAGS sem corpo.
+                if isinstance(parte, tuple) and parte[1] is not None:
+                    m = _UID_RESP.search(parte[0])
+                    if m:
+                        lote.append((m.group(1).decode(), parte[1]))
+            lote.sort(key=lambda x: int(x[0]))
+            yield lote
     finally:
+        _sair(M)
+
+
+def _em_paralelo(gerador, folga=2):
+    """Consome `gerador` numa thread, até `folga` itens à frente de quem lê.
+
+    É o pipeline do IMAP: enquanto o lote N é decodificado, parseado e
+    gravado, a thread já espera o FETCH do lote N+1. A conexão IMAP é só da
+    thread (imaplib não é thread-safe). Exceção do gerador sobe para quem lê.
+    """
+    fila = queue.Queue(maxsize=folga)
+    parar = threading.Event()
+
+    def produzir():
         try:
-            M.close()
-        except Exception:
-            pass
-        M.logout()
+            for item in gerador:
+                fila.put((True, item))
+                if parar.is_set():
+                    break
+            fila.put((False, None))
+        except Exception as e:
+            fila.put((False, e))
+        finally:
+            gerador.close()
+
+    t = threading.Thread(target=produzir, name="els-imap", daemon=True)
+    t.start()
+    try:
+        while True:
+            tem, item = fila.get()
+            if not tem:
+                if item is not None:
+                    raise item
+                return
+            yield item
+    finally:
+        parar.set()
+        while t.is_alive():      # quem lê parou antes: destrava o put()
+            try:
+                fila.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+def _buscar_lotes(cfg_dias=1, apenas_nao_lidos=True, cursor=None, estado=None,
+                  tamanho=None):
+    """Gera listas [(uid, assunto, texto)], um lote por UID FETCH.
+
+    NAO marca como lida: a marcacao e feita por marcar_lidos(), somente apos a
+    gravacao ter dado commit com sucesso. Assim um erro de gravacao NUNCA
+    consome o e-mail em silencio (ele fica nao-lido e e reprocessado).
+    Usa UID (identificador estavel) para casar com marcar_lidos().
+    """
+    estado = {} if estado is None else estado
+    gerador = _lotes_imap(cfg_dias, apenas_nao_lidos, cursor, estado,
+                          tamanho or LOTE_FETCH)
+    for lote in _em_paralelo(gerador):
+        saida = []
+        for uid, corpo in lote:
+            msg = email.message_from_bytes(corpo)
+            saida.append((uid, _decode(msg.get("Subject", "")), _texto_msg(msg)))
+        yield saida
+
+
+def _buscar(cfg_dias=1, apenas_nao_lidos=True):
+    """Retorna [(uid, assunto, texto)] das mensagens do ELS (tudo de uma vez)."""
+    return [m for lote in _buscar_lotes(cfg_dias, apenas_nao_lidos) for m in lote]
 
 
 def marcar_lidos(uids):
     """Marca \\Seen SOMENTE os e-mails cujos UIDs gravaram com sucesso."""
     if not uids:
         return
-    host = _cfg("ELS_MAIL_IMAP_HOST", "imap.titan.email")
-    port = int(_cfg("ELS_MAIL_IMAP_PORT", "993"))
-    user = _cfg("ELS_MAIL_USER")
-    pwd = _cfg("ELS_MAIL_PASSWORD")
-    mailbox = _cfg("ELS_MAIL_MAILBOX", "INBOX")
-    if not user or not pwd:
+    M = _conectar()
+    if M is None:
         return
-    M = imaplib.IMAP4_SSL(host, port)
     try:
-        M.login(user, pwd)
-        M.select(mailbox)
-        for uid in uids:
-            M.uid("STORE", uid, "+FLAGS", "\\Seen")
+        M.select(_cfg("ELS_MAIL_MAILBOX", "INBOX"))
+        for fatia in _fatias(sorted(uids, key=int), LOTE_FETCH * 10):
+            M.uid("STORE", _conjunto(fatia), "+FLAGS", "\\Seen")
     finally:
-        try:
-            M.close()
-        except Exception:
-            pass
-        M.logout()
+        _sair(M)
+
+
+# ===========================================================================
+# Cursor do IMAP (maior UID já resolvido)
+# ===========================================================================
+
+def _caixa():
+    return "%s/%s" % (_cfg("ELS_MAIL_USER") or "", _cfg("ELS_MAIL_MAILBOX", "INBOX"))
+
+
+def _ler_cursor(cur):
+    """(uidvalidity, ultimo_uid) da caixa, ou None (sem tabela = sem cursor)."""
+    try:
+        cur.execute("SELECT uidvalidity, ultimo_uid FROM els_sincronizacao WHERE caixa = %s",
+                    (_caixa(),))
+        row = cur.fetchone()
+    except Exception:
+        _log.warning("[els] els_sincronizacao indisponível; busca pela janela.", exc_info=True)
+        return None
+    if not row:
+        return None
+    if isinstance(row, dict):
+        row = (row["uidvalidity"], row["ultimo_uid"])
+    return (int(row[0]), int(row[1])) if row[0] is not None and row[1] is not None else None
+
+
+def _novo_cursor(cursor, estado, ok_uids):
+    """Maior UID tal que ele e todos os anteriores estão resolvidos.
+
+    O primeiro da busca que falhou (ou nem veio no FETCH) segura o cursor: na
+    próxima rodada `UID n+1:*` ainda alcança ele. Tudo resolvido, o cursor
+    vai até UIDNEXT-1 -- o que ficou fora da busca (lido, outro remetente)
+    não interessa. Devolve None se nada andou.
+    """
+    validade = estado.get("uidvalidity")
+    if validade is None:
+        return None
+    ok = {int(u) for u in ok_uids}
+    uids = estado.get("uids") or []
+    topo = None
+    for u in uids:
+        if u not in ok:
+            break
+        topo = u
+    else:
+        if estado.get("uidnext"):
+            topo = max(topo or 0, estado["uidnext"] - 1)
+    if topo is None:
+        return None
+    if cursor and cursor[0] == validade and topo <= cursor[1]:
+        return None
+    return validade, topo
+
+
+def _gravar_cursor(cur, conn, novo):
+    try:
+        cur.execute(
+            "INSERT INTO els_sincronizacao (caixa, uidvalidity, ultimo_uid, atualizado_em)"
+            " VALUES (%s, %s, %s, NOW())"
+            " ON DUPLICATE KEY UPDATE uidvalidity = VALUES(uidvalidity),"
+            " ultimo_uid = VALUES(ultimo_uid), atualizado_em = VALUES(atualizado_em)",
+            (_caixa(), novo[0], novo[1]))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        _log.warning("[els] não gravou o cursor do IMAP (não crítico).", exc_info=True)
 
 
 # ===========================================================================
@@ -461,7 +661,7 @@ def slug_produto(nome):
     return None
 
 
-def resolver_produto_id(cur, nome):
+def resolver_produto_id(cur, nome, produtos=None):
     """Mapeia o nome do produto do e-mail para produto.id.
 
     1) match exato pelo nome (desempata cadastro duplicado)
@@ -472,11 +672,19 @@ def resolver_produto_id(cur, nome):
     chave generica 'DIESEL' casava com qualquer produto que contivesse a
     palavra, entao uma descarga de S500 podia ser gravada no produto S10 sem
     ninguem perceber. Melhor deixar NULL e aparecer no diagnostico.
+
+    `produtos` (um _Produtos) evita o SELECT do cadastro a cada chamada.
     """
     if not nome:
         return None, None
+    if produtos is not None:
+        return produtos.resolver(nome)
     cur.execute("SELECT id, nome FROM produto")
     rows = cur.fetchall()
+    return _casar_produto(rows, nome)
+
+
+def _casar_produto(rows, nome):
 
     alvo_txt = str(nome).strip().upper()
     for r in rows:
@@ -496,6 +704,23 @@ def resolver_produto_id(cur, nome):
     return None, None
 
 
+class _Produtos:
+    """Cadastro de produtos lido uma vez por rodada, com o resultado por nome."""
+
+    def __init__(self, cur):
+        self._cur = cur
+        self._rows = None
+        self._por_nome = {}
+
+    def resolver(self, nome):
+        if nome not in self._por_nome:
+            if self._rows is None:
+                self._cur.execute("SELECT id, nome FROM produto")
+                self._rows = self._cur.fetchall()
+            self._por_nome[nome] = _casar_produto(self._rows, nome)
+        return self._por_nome[nome]
+
+
 # ---------------------------------------------------------------------------
 # REMOVIDO: casar_frete()
 #
@@ -518,73 +743,83 @@ def resolver_produto_id(cur, nome):
 # Gravação
 # ===========================================================================
 
-def gravar_abertura(cur, ab: Abertura, cliente_id):
+_SQL_LEITURA = """
+    INSERT INTO leitura_tanque_diaria
+      (cliente_id, data_leitura, titulo, tanque, produto_id, produto_nome,
+       volume_atual, volume_20c, capacidade, volume_livre,
+       altura_mm, agua_mm, temperatura, origem)
+    VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,'els_email')
+    ON DUPLICATE KEY UPDATE
+       titulo=VALUES(titulo),
+       produto_id=VALUES(produto_id), produto_nome=VALUES(produto_nome),
+       volume_atual=VALUES(volume_atual), volume_20c=VALUES(volume_20c),
+       capacidade=VALUES(capacidade), volume_livre=VALUES(volume_livre),
+       altura_mm=VALUES(altura_mm), agua_mm=VALUES(agua_mm),
+       temperatura=VALUES(temperatura)
+"""
+
+_SQL_DESCARGA = """
+    INSERT INTO descargas_pendentes
+      (cliente_id, tanque, produto_nome, produto_id, data_descarga,
+       data_inicial, data_final, volume_inicial, volume_final,
+       total_descarga, total_descarga_20c, status, frete_id, descarga_id, chave)
+    VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
+"""
+
+
+def _linhas_abertura(cur, ab: Abertura, cliente_id, produtos=None):
+    """Parâmetros de _SQL_LEITURA, um por tanque."""
     # NAO truncar para .date(): preserva a hora exata da leitura (05:00, 12:30,
     # 23:30...) para guardar TODAS as medicoes do dia como registros separados.
     data_leitura = (ab.data_hora or datetime.now()).strftime("%Y-%m-%d %H:%M:%S")
-    titulo = ab.titulo
-    n = 0
+    linhas = []
     for t in ab.tanques:
-        produto_id, _ = resolver_produto_id(cur, t.produto)
-        cur.execute(
-            """
-            INSERT INTO leitura_tanque_diaria
-              (cliente_id, data_leitura, titulo, tanque, produto_id, produto_nome,
-               volume_atual, volume_20c, capacidade, volume_livre,
-               altura_mm, agua_mm, temperatura, origem)
-            VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,'els_email')
-            ON DUPLICATE KEY UPDATE
-               titulo=VALUES(titulo),
-               produto_id=VALUES(produto_id), produto_nome=VALUES(produto_nome),
-               volume_atual=VALUES(volume_atual), volume_20c=VALUES(volume_20c),
-               capacidade=VALUES(capacidade), volume_livre=VALUES(volume_livre),
-               altura_mm=VALUES(altura_mm), agua_mm=VALUES(agua_mm),
-               temperatura=VALUES(temperatura)
-            """,
-            (cliente_id, data_leitura, titulo, t.tanque, produto_id, t.produto,
+        produto_id, _ = resolver_produto_id(cur, t.produto, produtos)
+        linhas.append(
+            (cliente_id, data_leitura, ab.titulo, t.tanque, produto_id, t.produto,
              t.volume_atual_l, t.volume_atual_20c_l, t.capacidade_l,
-             t.volume_livre_l, t.altura_mm, t.agua_mm, t.temperatura_c),
-        )
-        n += 1
-    return n
+             t.volume_livre_l, t.altura_mm, t.agua_mm, t.temperatura_c))
+    return linhas
+
+
+def _linha_descarga(cur, dc: Descarga, cliente_id, produtos=None):
+    """(chave, parâmetros de _SQL_DESCARGA)."""
+    chave = f"{dc.tanque}-{(dc.data_final or dc.data_inicial or datetime.now()).strftime('%Y%m%d%H%M%S')}"
+    produto_id, _ = resolver_produto_id(cur, dc.produto, produtos)
+    data_ref = (dc.data_final or dc.data_inicial or datetime.now()).date()
+    # frete_id/descarga_id continuam NULL: as colunas seguem no banco (dados
+    # antigos preservados), mas o fluxo novo nao as preenche nem as exibe.
+    frete_id = None
+    descarga_id = None
+    return chave, (cliente_id, dc.tanque, dc.produto, produto_id,
+                   data_ref.strftime("%Y-%m-%d"), dc.data_inicial, dc.data_final,
+                   dc.volume_inicial_l, dc.volume_final_l, dc.total_descarga_l,
+                   dc.total_descarga_20c_l, "pendente", frete_id, descarga_id, chave)
 
 
-def gravar_descarga(cur, dc: Descarga, cliente_id):
+def gravar_abertura(cur, ab: Abertura, cliente_id, produtos=None):
+    linhas = _linhas_abertura(cur, ab, cliente_id, produtos)
+    for params in linhas:
+        cur.execute(_SQL_LEITURA, params)
+    return len(linhas)
+
+
+def gravar_descarga(cur, dc: Descarga, cliente_id, produtos=None):
     """Grava em descargas_pendentes SEMPRE como 'pendente'.
 
     NAO casa mais com `fretes` e NAO cria linha em `descargas` (ver o bloco
     "REMOVIDO: casar_frete()" acima). O vinculo certo e com a NF-e de compra e
     quem faz e o usuario, na tela /estoque.
     """
-    chave = f"{dc.tanque}-{(dc.data_final or dc.data_inicial or datetime.now()).strftime('%Y%m%d%H%M%S')}"
-    produto_id, _ = resolver_produto_id(cur, dc.produto)
-    data_ref = (dc.data_final or dc.data_inicial or datetime.now()).date()
+    chave, params = _linha_descarga(cur, dc, cliente_id, produtos)
 
     # idempotência: se já existe essa chave, não reprocessa
     cur.execute("SELECT id, status FROM descargas_pendentes WHERE chave=%s", (chave,))
     if cur.fetchone():
         return "duplicada"
 
-    # frete_id/descarga_id continuam NULL: as colunas seguem no banco (dados
-    # antigos preservados), mas o fluxo novo nao as preenche nem as exibe.
-    frete_id = None
-    descarga_id = None
-    status = "pendente"
-
-    cur.execute(
-        """
-        INSERT INTO descargas_pendentes
-          (cliente_id, tanque, produto_nome, produto_id, data_descarga,
-           data_inicial, data_final, volume_inicial, volume_final,
-           total_descarga, total_descarga_20c, status, frete_id, descarga_id, chave)
-        VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
-        """,
-        (cliente_id, dc.tanque, dc.produto, produto_id,
-         data_ref.strftime("%Y-%m-%d"), dc.data_inicial, dc.data_final,
-         dc.volume_inicial_l, dc.volume_final_l, dc.total_descarga_l,
-         dc.total_descarga_20c_l, status, frete_id, descarga_id, chave),
-    )
-    return status
+    cur.execute(_SQL_DESCARGA, params)
+    return "pendente"
 
 
 # ===========================================================================
@@ -596,39 +831,87 @@ def _resumo_vazio():
             "descargas_pendentes": 0, "duplicadas": 0, "ignorados": 0}
 
 
-def _processar_mensagens(cur, conn, mensagens, cliente_id):
-    """Loop de parse+gravar+commit de uma lista de mensagens (uid, assunto, texto).
+def _somar(resumo, parcial):
+    for k, v in parcial.items():
+        resumo[k] = resumo.get(k, 0) + v
 
-    NAO marca e-mails como lidos: quem chama decide (processar() marca;
-    reprocessar() nao). Retorna (resumo, ok_uids), onde ok_uids sao os e-mails
-    que passaram SEM excecao (gravados OU ignorados de proposito). Falhas caem no
-    except, dao rollback e NAO entram em ok_uids (ficam nao-lidos p/ reprocessar).
-    """
-    resumo = _resumo_vazio()
-    ok_uids = []
+
+def _parsear(mensagens):
+    """[(uid, assunto, tipo, objeto)]; objeto None = ignorado. Parse que
+    explode fica de fora (não entra em ok_uids, segue não-lido)."""
+    saida = []
     for uid, assunto, texto in mensagens:
         tipo = detectar_tipo(assunto, texto)
         try:
             if tipo == "ABERTURA":
-                ab = parse_abertura(texto)
-                resumo["leituras"] += gravar_abertura(cur, ab, cliente_id)
-                resumo["aberturas"] += 1
-                conn.commit()
+                saida.append((uid, assunto, tipo, parse_abertura(texto)))
             elif tipo == "DESCARGA":
-                dc = parse_descarga(texto)
-                if dc:
-                    st = gravar_descarga(cur, dc, cliente_id)
-                    if st == "vinculada":
-                        resumo["descargas_vinculadas"] += 1
-                    elif st == "pendente":
-                        resumo["descargas_pendentes"] += 1
-                    elif st == "duplicada":
-                        resumo["duplicadas"] += 1
-                    conn.commit()
-                else:
-                    resumo["ignorados"] += 1
+                saida.append((uid, assunto, tipo, parse_descarga(texto)))
+            else:
+                saida.append((uid, assunto, None, None))
+        except Exception:
+            _log.warning("[els] falha ao processar '%s'.", assunto, exc_info=True)
+    return saida
+
+
+def _gravar_lote(cur, conn, parseadas, cliente_id, produtos):
+    """O lote inteiro numa transação: um executemany de leituras, um
+    `chave IN (...)` e um executemany de descargas. Levanta se falhar."""
+    resumo = _resumo_vazio()
+    leituras, descargas = [], []
+    for _uid, _assunto, tipo, obj in parseadas:
+        if obj is None:
+            resumo["ignorados"] += 1
+        elif tipo == "ABERTURA":
+            linhas = _linhas_abertura(cur, obj, cliente_id, produtos)
+            leituras.extend(linhas)
+            resumo["leituras"] += len(linhas)
+            resumo["aberturas"] += 1
+        else:
+            descargas.append(_linha_descarga(cur, obj, cliente_id, produtos))
+
+    if descargas:
+        chaves = sorted({c for c, _p in descargas})
+        cur.execute("SELECT chave FROM descargas_pendentes WHERE chave IN (%s)"
+                    % ",".join(["%s"] * len(chaves)), chaves)
+        existentes = {(r["chave"] if isinstance(r, dict) else r[0]) for r in cur.fetchall()}
+        novas = []
+        for chave, params in descargas:
+            if chave in existentes:
+                resumo["duplicadas"] += 1
             else:
+                existentes.add(chave)          # mesma descarga 2x no lote
+                novas.append(params)
+                resumo["descargas_pendentes"] += 1
+        if novas:
+            cur.executemany(_SQL_DESCARGA, novas)
+    if leituras:
+        cur.executemany(_SQL_LEITURA, leituras)
+    conn.commit()
+    return resumo
+
+
+def _gravar_uma_a_uma(cur, conn, parseadas, cliente_id, produtos):
+    """Caminho antigo: commit por mensagem, falha só derruba aquela."""
+    resumo = _resumo_vazio()
+    ok_uids = []
+    for uid, assunto, tipo, obj in parseadas:
+        try:
+            if obj is None:
                 resumo["ignorados"] += 1
+            elif tipo == "ABERTURA":
+                resumo["leituras"] += gravar_abertura(cur, obj, cliente_id, produtos)
+                resumo["aberturas"] += 1
+                conn.commit()
+            else:
+                st = gravar_descarga(cur, obj, cliente_id, produtos)
+                if st == "vinculada":
+                    resumo["descargas_vinculadas"] += 1
+                elif st == "pendente":
+                    resumo["descargas_pendentes"] += 1
+                elif st == "duplicada":
+                    resumo["duplicadas"] += 1
+                conn.commit()
             # Chegou aqui sem excecao (gravou/duplicada/ignorado deliberadamente).
             ok_uids.append(uid)
         except Exception:
@@ -637,11 +920,55 @@ def _processar_mensagens(cur, conn, mensagens, cliente_id):
     return resumo, ok_uids
 
 
+def _processar_mensagens(cur, conn, mensagens, cliente_id, produtos=None, avisar=True):
+    """Parse+gravar+commit de um lote de mensagens (uid, assunto, texto).
+
+    NAO marca e-mails como lidos: quem chama decide (processar() marca;
+    reprocessar() nao). Retorna (resumo, ok_uids), onde ok_uids sao os e-mails
+    que passaram SEM excecao (gravados OU ignorados de proposito). Falhas dao
+    rollback e NAO entram em ok_uids (ficam nao-lidos p/ reprocessar).
+
+    Grava o lote de uma vez (_gravar_lote); se o lote falhar, rollback e
+    refaz mensagem a mensagem para isolar a ruim.
+    """
+    produtos = produtos if produtos is not None else _Produtos(cur)
+    parseadas = _parsear(mensagens)
+    try:
+        resumo = _gravar_lote(cur, conn, parseadas, cliente_id, produtos)
+        ok_uids = [p[0] for p in parseadas]
+    except Exception:
+        conn.rollback()
+        _log.warning("[els] lote de %d e-mail(s) falhou; gravando um a um.",
+                     len(parseadas), exc_info=True)
+        resumo, ok_uids = _gravar_uma_a_uma(cur, conn, parseadas, cliente_id, produtos)
+    if avisar and (resumo["leituras"] or resumo["descargas_pendentes"]
+                   or resumo["descargas_vinculadas"]):
+        notificar_saldo()  # abertura/descarga nova -> saldo em tempo real
+    return resumo, ok_uids
+
+
+def _processar_caixa(cur, conn, cliente_id, dias, apenas_nao_lidos, cursor=None, estado=None):
+    """Pipeline: cada lote do IMAP é parseado e gravado enquanto o próximo
+    chega. Devolve (resumo, ok_uids)."""
+    resumo, ok_uids = _resumo_vazio(), []
+    produtos = _Produtos(cur)
+    for lote in _buscar_lotes(dias, apenas_nao_lidos, cursor, estado):
+        parcial, ok = _processar_mensagens(cur, conn, lote, cliente_id, produtos,
+                                           avisar=False)
+        _somar(resumo, parcial)
+        ok_uids.extend(ok)
+    if resumo["leituras"] or resumo["descargas_pendentes"] or resumo["descargas_vinculadas"]:
+        notificar_saldo()  # abertura/descarga nova -> saldo em tempo real
+    return resumo, ok_uids
+
+
 def processar(dias=1):
     """Busca e-mails NAO LIDOS do ELS, grava e MARCA como lidos. (scheduler)
 
-    Comportamento inalterado: le so os UNSEEN da janela e, ao fim, marca lidos
-    APENAS os UIDs que gravaram sem erro.
+    Le so os UNSEEN e, ao fim, marca lidos APENAS os UIDs que gravaram sem
+    erro. Com cursor em els_sincronizacao a busca e `UID n+1:*` em vez da
+    janela de `dias` (que so vale na primeira rodada ou se a caixa trocar de
+    UIDVALIDITY).
     """
     ensure_tables()
     cliente_id = _cliente_id()
@@ -649,18 +976,20 @@ def processar(dias=1):
         _log.warning("[els] ELS_CLIENTE_ID não configurado; abortando.")
         return {"erro": "ELS_CLIENTE_ID ausente"}
 
-    mensagens = _buscar(cfg_dias=dias, apenas_nao_lidos=True)
-    if not mensagens:
-        return _resumo_vazio()
-
     conn = get_db_connection()
     cur = conn.cursor(dictionary=True)
     try:
-        resumo, ok_uids = _processar_mensagens(cur, conn, mensagens, cliente_id)
+        cursor = _ler_cursor(cur)
+        estado = {}
+        resumo, ok_uids = _processar_caixa(cur, conn, cliente_id, dias, True,
+                                           cursor, estado)
+        marcar_lidos(ok_uids)  # so os UIDs que gravaram; falhas ficam nao-lidas
+        novo = _novo_cursor(cursor, estado, ok_uids)
+        if novo:
+            _gravar_cursor(cur, conn, novo)
     finally:
         cur.close()
         conn.close()
-    marcar_lidos(ok_uids)  # so os UIDs que gravaram; falhas ficam nao-lidas
     _log.info("[els] resumo: %s", resumo)
     return resumo
 
@@ -681,15 +1010,11 @@ def reprocessar(dias=3):
         _log.warning("[els] ELS_CLIENTE_ID não configurado; abortando reprocessar.")
         return {"erro": "ELS_CLIENTE_ID ausente"}
 
-    mensagens = _buscar(cfg_dias=dias, apenas_nao_lidos=False)
-    if not mensagens:
-        return {"novas": 0, "duplicadas": 0, "ignorados": 0,
-                "aberturas": 0, "leituras": 0}
-
     conn = get_db_connection()
     cur = conn.cursor(dictionary=True)
     try:
-        resumo, _ok_uids = _processar_mensagens(cur, conn, mensagens, cliente_id)
+        # Sem cursor: reler e a janela inteira, lidos inclusive.
+        resumo, _ok_uids = _processar_caixa(cur, conn, cliente_id, dias, False)
     finally:
         cur.close()
         conn.close()
@@ -1,3 +1,4 @@
+import codecs
 import re
 import hashlib
 from datetime import datetime
@@ -134,8 +135,15 @@ class OFXParser:
         idx = content.find('<')
         if idx == -1:
             return content
-        body = content[idx:]
+        return OFXParser._normalize(content[idx:])
 
+    @staticmethod
+    def _normalize(body: str) -> str:
+        """
+        Normaliza quebras de linha e fecha tags SGML folha de um trecho OFX.
+        Usado no corpo inteiro (`_extract_body`) e bloco a bloco no parser
+        em streaming (`iter_transactions`) — o resultado é o mesmo.
+        """
         # Normaliza CRLF do Windows e CR soltos para que um \r não seja confundido
         # com valor de tag, o que causaria <STMTTRN>\r → <STMTTRN>\r</STMTTRN>
         # e quebraria a extração de transações.
@@ -148,8 +156,10 @@ class OFXParser:
             value = m.group(2).strip()
             close_tag = f'</{tag}>'
             # Verifica se o corpo original já possui a tag de fechamento após este trecho
-            after = body[m.end():]
-            if after.lower().startswith(close_tag.lower()):
+            # (compara só o trecho do tamanho da tag: fatiar o resto do corpo a
+            # cada tag deixava o parse quadrático no tamanho do arquivo)
+            after = body[m.end():m.end() + len(close_tag)]
+            if after.lower() == close_tag.lower():
                 return m.group(0)  # tag de fechamento já presente – mantém sem alteração
             return f'<{tag}>{value}{close_tag}'
 
@@ -179,7 +189,8 @@ class OFXParser:
             search = m.group(1)
         return search.strip()
 
-    def _parse_transaction_block(self, block: str) -> dict | None:
+    @staticmethod
+    def _parse_transaction_block(block: str) -> dict | None:
         """Faz o parse de um bloco <STMTTRN> e retorna um dicionário de transação."""
 
         def tag(name):
@@ -226,7 +237,7 @@ class OFXParser:
 
         # Converte a data
         try:
-            data_transacao = self._parse_date(dtposted)
+            data_transacao = OFXParser._parse_date(dtposted)
         except ValueError:
             return None
 
@@ -238,7 +249,7 @@ class OFXParser:
         cnpj_cpf, tipo_chave = _extract_cnpj_cpf(combined)
 
         # Gera o hash para deduplicação
-        hash_dedup = self._make_hash(fitid, dtposted, trnamt, descricao)
+        hash_dedup = OFXParser._make_hash(fitid, dtposted, trnamt, descricao)
 
         return {
             'fitid': fitid,
@@ -273,3 +284,98 @@ class OFXParser:
         """Gera um digest SHA-256 em hexadecimal para deduplicação."""
         raw = f'{fitid}|{dtposted}|{trnamt}|{descricao}'
         return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+# ----------------------------------------------------------------------
+# Parser em streaming
+# ----------------------------------------------------------------------
+
+_STREAM_CHUNK = 64 * 1024
+
+_RE_STMTTRN_INICIO = re.compile(r'<STMTTRN>', re.IGNORECASE)
+# Fim de um bloco: o fechamento explícito (XML / SGML bem formado) ou, no SGML
+# que omite </STMTTRN>, a abertura do próximo bloco / o fim da lista.
+_RE_STMTTRN_FIM = re.compile(
+    r'</STMTTRN>|<STMTTRN>|</BANKTRANLIST>|</STMTTRNRS>|</OFX>',
+    re.IGNORECASE,
+)
+
+
+def _iter_text_chunks(source, encoding: str, chunk_size: int):
+    """Converte *source* em pedaços de texto, sem ler tudo para a memória.
+
+    Aceita str, bytes, objeto arquivo (texto ou binário, com .read()) ou um
+    iterável de pedaços str/bytes (ex.: resposta HTTP em iter_content()).
+    """
+    if isinstance(source, str):
+        for i in range(0, len(source), chunk_size):
+            yield source[i:i + chunk_size]
+        return
+    if isinstance(source, (bytes, bytearray)):
+        source = [bytes(source[i:i + chunk_size]) for i in range(0, len(source), chunk_size)]
+
+    if hasattr(source, 'read'):
+        def _pieces():
+            while True:
+                piece = source.read(chunk_size)
+                if not piece:
+                    return
+                yield piece
+        pieces = _pieces()
+    else:
+        pieces = iter(source)
+
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    for piece in pieces:
+        if isinstance(piece, str):
+            yield piece
+        else:
+            text = decoder.decode(piece)
+            if text:
+                yield text
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+
+def iter_transactions(source, encoding: str = 'latin-1', chunk_size: int = _STREAM_CHUNK):
+    """
+    Gera as transações de um OFX (SGML v1.x ou XML v2.x) uma a uma, com
+    memória limitada ao pedaço lido + um bloco <STMTTRN>.
+
+    Cada item tem o mesmo formato de `OFXParser.get_transactions()` (inclusive
+    o hash_dedup), então o resultado pode ir direto para `_save_transactions`.
+    Blocos inválidos (valor ou data ilegíveis) são ignorados, como no parser
+    em memória.
+    """
+    buf = ''
+    keep = len('<STMTTRN>') - 1  # marcador pode chegar partido entre pedaços
+
+    def _emit(block):
+        return OFXParser._parse_transaction_block(OFXParser._normalize(block))
+
+    for text in _iter_text_chunks(source, encoding, chunk_size):
+        buf += text
+        pos = 0
+        while True:
+            ini = _RE_STMTTRN_INICIO.search(buf, pos)
+            if not ini:
+                buf = buf[max(pos, len(buf) - keep):]
+                break
+            fim = _RE_STMTTRN_FIM.search(buf, ini.end())
+            if not fim:
+                buf = buf[ini.start():]
+                break
+            tx = _emit(buf[ini.end():fim.start()])
+            if tx:
+                yield tx
+            # </STMTTRN> é consumido; qualquer outro delimitador fica no buffer
+            # (pode ser a abertura do próximo bloco).
+            fechou = fim.group(0).lower() == '</stmttrn>'
+            pos = fim.end() if fechou else fim.start()
+
+    ini = _RE_STMTTRN_INICIO.search(buf)
+    if ini:
+        tx = _emit(buf[ini.end():])
+        if tx:
+            yield tx
@@ -22,6 +22,7 @@ Design (igual ao aplicar_regras da compra):
   usam %s). Funciona tanto com cursor tuple quanto dictionary=True.
 - NAO faz commit -- quem chama controla a transacao.
 """
+from utils.cnpj_digitos import digitos
 
 # cod_anp -> produto_id, SO os que nao tem ambiguidade (gasolina fica de fora).
 FALLBACK_ANP = {
@@ -48,8 +49,7 @@ def _empresa_vende(cur, cnpj_emitente, produto_id):
     if not cnpj_emitente or not produto_id:
         return True
     cur.execute(
-        "SELECT id FROM clientes "
-        "WHERE REPLACE(REPLACE(REPLACE(cnpj,'.',''),'/',''),'-','') = %s LIMIT 1",
+        "SELECT id FROM clientes WHERE %s = %%s LIMIT 1" % digitos('clientes'),
         (cnpj_emitente,),
     )
     cid = _scalar(cur.fetchone())
@@ -125,3 +125,90 @@ def aplicar_depara_venda(cur, venda_id):
             )
             n += 1
     return n
+
+
+def _valores(row):
+    """Valores de uma linha na ordem do SELECT (tuple ou dict)."""
+    return tuple(row.values()) if isinstance(row, dict) else tuple(row)
+
+
+class DeparaVenda:
+    """A MESMA regra de resolver_produto_id_venda, com as tabelas de apoio
+    carregadas uma vez por LOTE de vendas (ingestao em massa da /api/vendas).
+
+    carregar(cur, cnpjs) traz, para todos os emitentes do lote de uma vez, o
+    de-para ativo (cnpj + cprod) e o allow-list de cliente_produtos; depois
+    resolver() nao vai mais ao banco para esses emitentes. Emitente que nao foi
+    carregado antes e carregado sob demanda.
+    """
+
+    def __init__(self):
+        self._carregados = set()
+        self._depara = {}    # (cnpj_emitente, cprod) -> produto_id
+        self._allow = {}     # cnpj_emitente -> None (validacao pulada) | set(produto_id)
+
+    def carregar(self, cur, cnpjs):
+        novos = sorted({c for c in cnpjs if c} - self._carregados)
+        if not novos:
+            return
+        marcas = ",".join(["%s"] * len(novos))
+
+        cur.execute(
+            "SELECT cnpj_emitente, cprod, produto_id FROM vendas_xml_depara_produto "
+            f"WHERE cnpj_emitente IN ({marcas}) AND ativo = 1",
+            novos,
+        )
+        for row in cur.fetchall():
+            cnpj, cprod, pid = _valores(row)[:3]
+            self._depara.setdefault((cnpj, cprod), pid)
+
+        doc = digitos('clientes')
+        cur.execute(
+            f"SELECT {doc}, id FROM clientes "
+            f"WHERE {doc} IN ({marcas})",
+            novos,
+        )
+        cliente_de = {}
+        for row in cur.fetchall():
+            doc, cid = _valores(row)[:2]
+            cliente_de.setdefault(doc, cid)
+
+        produtos = {}
+        if cliente_de:
+            ids = sorted(set(cliente_de.values()))
+            cur.execute(
+                "SELECT cliente_id, produto_id FROM cliente_produtos "
+                "WHERE cliente_id IN (%s) AND ativo = 1" % ",".join(["%s"] * len(ids)),
+                ids,
+            )
+            for row in cur.fetchall():
+                cid, pid = _valores(row)[:2]
+                produtos.setdefault(cid, set()).add(pid)
+
+        for cnpj in novos:
+            cid = cliente_de.get(cnpj)
+            # Mesmo criterio de _empresa_vende: emitente nao mapeado ou empresa
+            # sem produtos cadastrados -> nao bloqueia.
+            self._allow[cnpj] = produtos.get(cid) if cid else None
+            self._carregados.add(cnpj)
+
+    def _empresa_vende(self, cnpj_emitente, produto_id):
+        if not cnpj_emitente or not produto_id:
+            return True
+        permitidos = self._allow.get(cnpj_emitente)
+        return not permitidos or produto_id in permitidos
+
+    def resolver(self, cur, cnpj_emitente, cprod, cod_anp):
+        """Mesmo retorno de resolver_produto_id_venda(cur, ...)."""
+        if cnpj_emitente and cnpj_emitente not in self._carregados:
+            self.carregar(cur, [cnpj_emitente])
+
+        if cnpj_emitente and cprod:
+            pid = self._depara.get((cnpj_emitente, cprod))
+            if pid:
+                return pid if self._empresa_vende(cnpj_emitente, pid) else None
+
+        pid = FALLBACK_ANP.get((cod_anp or '').strip())
+        if pid:
+            return pid if self._empresa_vende(cnpj_emitente, pid) else None
+        return None
@@ -0,0 +1,40 @@
+-- Migration: agendador — processo dedicado dos jobs periódicos (integrations/agendador.py)
+-- Scope: agendador_execucoes guarda o histórico de cada rodada E a fila dos
+-- pedidos "disparar agora" da web (status='fila', e o processo do agendador
+-- reivindica com UPDATE ... WHERE status='fila'). agendador_jobs tem uma
+-- linha por job com as métricas da última rodada e a próxima execução.
+-- visto_em é o batimento do processo (a web usa para dizer se ele está no ar)
+-- e, na execução, o batimento da rodada 'rodando' (_encerrar_orfas).
+CREATE TABLE IF NOT EXISTS agendador_execucoes (
+    id          BIGINT       NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    job         VARCHAR(64)  NOT NULL,
+    origem      VARCHAR(16)  NOT NULL DEFAULT 'agendador',
+    status      VARCHAR(16)  NOT NULL,
+    pedido_por  VARCHAR(120) NULL,
+    pedido_em   DATETIME     NOT NULL,
+    inicio      DATETIME     NULL,
+    fim         DATETIME     NULL,
+    duracao_ms  INT          NULL,
+    linhas      INT          NULL,
+    detalhe     VARCHAR(500) NULL,
+    processo    VARCHAR(80)  NULL,
+    visto_em    DATETIME     NULL,
+    KEY ix_status (status, id),
+    KEY ix_job (job, id),
+    KEY ix_pedido_em (pedido_em)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS agendador_jobs (
+    job               VARCHAR(64)  NOT NULL PRIMARY KEY,
+    descricao         VARCHAR(200) NULL,
+    agenda            VARCHAR(120) NULL,
+    automatico        TINYINT(1)   NOT NULL DEFAULT 1,
+    proxima_execucao  DATETIME     NULL,
+    ultima_execucao   DATETIME     NULL,
+    ultimo_status     VARCHAR(16)  NULL,
+    ultima_duracao_ms INT          NULL,
+    ultimas_linhas    INT          NULL,
+    execucoes         INT          NOT NULL DEFAULT 0,
+    falhas            INT          NOT NULL DEFAULT 0,
+    visto_em          DATETIME     NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
@@ -0,0 +1,9 @@
+-- Migration: cache_versoes — versão dos caches em memória dos workers
+-- Scope: uma linha por cache ('contas_contabeis'). Quem grava a configuração
+-- incrementa versao na mesma transação (utils/contas_contabeis.invalidar); o
+-- worker compara com a versão do que tem em memória e recarrega se mudou.
+CREATE TABLE IF NOT EXISTS cache_versoes (
+    nome          VARCHAR(64) NOT NULL PRIMARY KEY,
+    versao        BIGINT      NOT NULL DEFAULT 0,
+    atualizado_em DATETIME    NOT NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
@@ -0,0 +1,16 @@
+-- Migration: dashboard_metricas — blocos de KPI materializados da home (bases.index)
+-- Scope: uma linha por (mês, empresa, bloco) com o JSON do bloco. A home faz UMA
+-- leitura pela PK; o agendador (integrations/dashboard_scheduler) recalcula os
+-- blocos marcados como sujos, e as rotas que gravam fretes/pedidos/vendas_posto/
+-- FIFO marcam os blocos afetados (utils/dashboard_metricas.invalidar).
+CREATE TABLE IF NOT EXISTS dashboard_metricas (
+    ano_mes       CHAR(7)     NOT NULL,
+    empresa_id    INT         NOT NULL DEFAULT 0,
+    bloco         VARCHAR(32) NOT NULL,
+    dados         LONGTEXT    NOT NULL,
+    sujo          TINYINT(1)  NOT NULL DEFAULT 0,
+    versao        INT         NOT NULL DEFAULT 0,
+    atualizado_em DATETIME    NOT NULL,
+    PRIMARY KEY (ano_mes, empresa_id, bloco),
+    KEY ix_sujo (sujo)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
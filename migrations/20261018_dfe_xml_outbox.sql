@@ -0,0 +1,20 @@
+-- Migration: dfe_xml_outbox — fila dos XML de DFe a caminho do Dropbox
+-- Scope: a captura grava o XML no spool local e uma linha aqui, na mesma
+-- transação do documento; o drenador (integrations/dfe_xml_spool) sobe para o
+-- Dropbox. A captura também cria a tabela sozinha (CREATE TABLE IF NOT EXISTS).
+CREATE TABLE IF NOT EXISTS dfe_xml_outbox (
+    id                BIGINT AUTO_INCREMENT PRIMARY KEY,
+    caminho           VARCHAR(300) NOT NULL,
+    sha256            CHAR(64)     NOT NULL,
+    tamanho           INT          NOT NULL,
+    tabela            VARCHAR(20)  NOT NULL,
+    chave             VARCHAR(60)  NOT NULL,
+    status            VARCHAR(10)  NOT NULL DEFAULT 'pendente',
+    tentativas        INT          NOT NULL DEFAULT 0,
+    proxima_tentativa DATETIME     NULL,
+    ultimo_erro       VARCHAR(300) NULL,
+    criado_em         TIMESTAMP    NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    enviado_em        DATETIME     NULL,
+    UNIQUE KEY uk_caminho (caminho),
+    KEY ix_status (status, proxima_tentativa)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
@@ -0,0 +1,12 @@
+-- Migration: efi_sincronizacao — cursor da reconciliação EFI do agendador
+-- Scope: uma linha por rotina ('reconcilia'). ultima_varredura é a última
+-- rodada COMPLETA (janela com piso de dias); entre varreduras o agendador só
+-- pergunta à EFI desde a cobrança aberta mais antiga
+-- (integrations/efi_reconcilia.janela_agendador).
+CREATE TABLE IF NOT EXISTS efi_sincronizacao (
+    nome             VARCHAR(32) NOT NULL PRIMARY KEY,
+    ultima_execucao  DATETIME    NOT NULL,
+    ultima_varredura DATETIME    NULL,
+    begin_date       DATE        NULL,
+    total_efi        INT         NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
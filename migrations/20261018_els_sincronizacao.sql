@@ -0,0 +1,11 @@
+-- Migration: els_sincronizacao — cursor do IMAP da importação ELS
+-- Scope: uma linha por caixa ('usuario/INBOX'). ultimo_uid é o maior UID já
+-- resolvido (gravado ou ignorado de propósito) sem nenhuma falha antes dele;
+-- a próxima busca de integrations/els_email.processar é `UID ultimo_uid+1:*`.
+-- uidvalidity diferente na caixa = cursor inválido, volta para a janela SENTSINCE.
+CREATE TABLE IF NOT EXISTS els_sincronizacao (
+    caixa         VARCHAR(190) NOT NULL PRIMARY KEY,
+    uidvalidity   BIGINT       NOT NULL,
+    ultimo_uid    BIGINT       NOT NULL,
+    atualizado_em DATETIME     NOT NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
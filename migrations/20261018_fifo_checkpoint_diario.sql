@@ -0,0 +1,15 @@
+-- Migration: fifo_checkpoint_diario — camadas FIFO no início de um dia
+-- Scope: cache de replay do relatório Lucro Postos (cliente + produto + data).
+-- Os triggers de invalidação (fretes / vendas_posto / fifo_abertura) são
+-- (re)criados em app._ensure_lucro_postos_tables a cada start, junto dos
+-- demais triggers do módulo.
+
+CREATE TABLE IF NOT EXISTS `fifo_checkpoint_diario` (
+    `id` INT AUTO_INCREMENT PRIMARY KEY,
+    `cliente_id` INT NOT NULL,
+    `produto_id` INT NOT NULL,
+    `data` DATE NOT NULL,
+    `camadas` MEDIUMTEXT NOT NULL,
+    `criado_em` DATETIME DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE KEY `uk_fifo_checkpoint` (`cliente_id`, `produto_id`, `data`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
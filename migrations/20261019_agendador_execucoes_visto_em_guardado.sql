@@ -0,0 +1,26 @@
+-- Migration: agendador_execucoes.visto_em — batimento das rodadas em andamento
+-- Scope: o processo do agendador carimba visto_em nas suas rodadas 'rodando'
+-- a cada batimento. Ao subir, um processo novo só encerra como órfãs as
+-- rodadas de outro processo sem batimento há mais de VIVO_SEG (o antigo pode
+-- ainda estar de pé durante o deploy).
+-- Substitui 20261019_agendador_execucoes_visto_em.sql, que usava ADD COLUMN
+-- IF NOT EXISTS (não existe no MySQL 8) e nunca criou a coluna. Bancos novos
+-- já a recebem no CREATE TABLE de 20261018_agendador.sql.
+
+SET @col_exists = (
+    SELECT COUNT(*)
+    FROM INFORMATION_SCHEMA.COLUMNS
+    WHERE TABLE_SCHEMA = DATABASE()
+      AND TABLE_NAME   = 'agendador_execucoes'
+      AND COLUMN_NAME  = 'visto_em'
+);
+
+SET @sql = IF(
+    @col_exists = 0,
+    'ALTER TABLE agendador_execucoes ADD COLUMN visto_em DATETIME NULL AFTER processo',
+    'SELECT ''coluna visto_em já existe'' AS info'
+);
+
+PREPARE stmt FROM @sql;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
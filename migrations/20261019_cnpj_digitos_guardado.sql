@@ -0,0 +1,104 @@
+-- Migration: cnpj_digitos — CNPJ só com dígitos, persistido e indexado
+-- Substitui 20261018_cnpj_digitos.sql, que usava ADD COLUMN/ADD INDEX
+-- IF NOT EXISTS (sintaxe que o MySQL 8 não tem): cada ALTER falhava, o runner
+-- gravava a migration como aplicada e as colunas nunca existiram.
+--
+-- Aqui cada ALTER só roda se o information_schema disser que falta. Colunas
+-- geradas STORED: o MySQL calcula no INSERT/UPDATE e preenche as linhas
+-- existentes no próprio ALTER (clientes e fornecedores são cadastros
+-- pequenos). bank_transactions.cnpj_cpf_digitos NÃO entra aqui: o ADD de
+-- coluna STORED reconstrói a tabela inteira com a escrita bloqueada -- roda
+-- fora do horário com scripts/backfill_cnpj_digitos.py --aplicar. Até lá as
+-- consultas usam a normalização antiga (utils/cnpj_digitos.py).
+
+SET @col_exists = (
+    SELECT COUNT(*)
+    FROM INFORMATION_SCHEMA.COLUMNS
+    WHERE TABLE_SCHEMA = DATABASE()
+      AND TABLE_NAME   = 'clientes'
+      AND COLUMN_NAME  = 'cnpj_digitos'
+);
+
+SET @sql = IF(
+    @col_exists = 0,
+    'ALTER TABLE clientes ADD COLUMN cnpj_digitos VARCHAR(64) AS (REPLACE(REPLACE(REPLACE(REPLACE(cnpj,''.'',''''),''/'',''''),''-'',''''),'' '','''')) STORED',
+    'SELECT ''coluna clientes.cnpj_digitos já existe'' AS info'
+);
+
+PREPARE stmt FROM @sql;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
+SET @idx_exists = (
+    SELECT COUNT(*)
+    FROM INFORMATION_SCHEMA.STATISTICS
+    WHERE TABLE_SCHEMA = DATABASE()
+      AND TABLE_NAME   = 'clientes'
+      AND INDEX_NAME   = 'idx_clientes_cnpj_digitos'
+);
+
+SET @sql = IF(
+    @idx_exists = 0,
+    'CREATE INDEX idx_clientes_cnpj_digitos ON clientes (cnpj_digitos)',
+    'SELECT ''índice idx_clientes_cnpj_digitos já existe'' AS info'
+);
+
+PREPARE stmt FROM @sql;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
+SET @col_exists = (
+    SELECT COUNT(*)
+    FROM INFORMATION_SCHEMA.COLUMNS
+    WHERE TABLE_SCHEMA = DATABASE()
+      AND TABLE_NAME   = 'fornecedores'
+      AND COLUMN_NAME  = 'cnpj_digitos'
+);
+
+SET @sql = IF(
+    @col_exists = 0,
+    'ALTER TABLE fornecedores ADD COLUMN cnpj_digitos VARCHAR(64) AS (REPLACE(REPLACE(REPLACE(REPLACE(cnpj,''.'',''''),''/'',''''),''-'',''''),'' '','''')) STORED',
+    'SELECT ''coluna fornecedores.cnpj_digitos já existe'' AS info'
+);
+
+PREPARE stmt FROM @sql;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
+SET @idx_exists = (
+    SELECT COUNT(*)
+    FROM INFORMATION_SCHEMA.STATISTICS
+    WHERE TABLE_SCHEMA = DATABASE()
+      AND TABLE_NAME   = 'fornecedores'
+      AND INDEX_NAME   = 'idx_fornecedores_cnpj_digitos'
+);
+
+SET @sql = IF(
+    @idx_exists = 0,
+    'CREATE INDEX idx_fornecedores_cnpj_digitos ON fornecedores (cnpj_digitos)',
+    'SELECT ''índice idx_fornecedores_cnpj_digitos já existe'' AS info'
+);
+
+PREPARE stmt FROM @sql;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
+-- O estoque parte do cliente (cl.id = %s) e chega nas vendas pelo CNPJ:
+-- com este índice o JOIN vai de clientes.cnpj_digitos direto às notas do dia.
+SET @idx_exists = (
+    SELECT COUNT(*)
+    FROM INFORMATION_SCHEMA.STATISTICS
+    WHERE TABLE_SCHEMA = DATABASE()
+      AND TABLE_NAME   = 'vendas_xml'
+      AND INDEX_NAME   = 'idx_vx_emitente_emissao'
+);
+
+SET @sql = IF(
+    @idx_exists = 0,
+    'CREATE INDEX idx_vx_emitente_emissao ON vendas_xml (cnpj_emitente, dh_emissao)',
+    'SELECT ''índice idx_vx_emitente_emissao já existe'' AS info'
+);
+
+PREPARE stmt FROM @sql;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
@@ -0,0 +1,25 @@
+-- Migration: dfe_xml_outbox.conteudo — cópia do XML no banco até o upload
+-- Scope: o spool local some num redeploy e não é visto pelo container web.
+-- O drenador e baixar_xml leem daqui quando o arquivo não está no disco.
+-- A coluna é zerada quando a linha vira 'enviado'. A captura também cria a
+-- coluna sozinha (dfe_xml_spool.garantir_tabela).
+-- Substitui 20261019_dfe_xml_outbox_conteudo.sql, que usava ADD COLUMN
+-- IF NOT EXISTS (não existe no MySQL 8).
+
+SET @col_exists = (
+    SELECT COUNT(*)
+    FROM INFORMATION_SCHEMA.COLUMNS
+    WHERE TABLE_SCHEMA = DATABASE()
+      AND TABLE_NAME   = 'dfe_xml_outbox'
+      AND COLUMN_NAME  = 'conteudo'
+);
+
+SET @sql = IF(
+    @col_exists = 0,
+    'ALTER TABLE dfe_xml_outbox ADD COLUMN conteudo MEDIUMBLOB NULL AFTER ultimo_erro',
+    'SELECT ''coluna conteudo já existe'' AS info'
+);
+
+PREPARE stmt FROM @sql;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
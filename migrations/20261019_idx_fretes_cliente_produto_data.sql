@@ -0,0 +1,62 @@
+-- Migration: idx_fretes_cliente_produto_data — índices para os filtros por mês
+-- Scope: o FIFO busca as compras (fretes) por (clientes_id, produto_id) +
+-- intervalo de data_frete, e os KPIs/gráfico do dashboard filtram só por
+-- data_frete. Ver utils/periodo_sql.py.
+-- Substitui 20261018_idx_fretes_cliente_produto_data.sql: ADD INDEX IF NOT
+-- EXISTS não existe no MySQL 8, o ALTER falhava e o runner gravava a
+-- migration como aplicada sem índice nenhum. Cada CREATE INDEX só roda se o
+-- information_schema disser que falta.
+
+SET @idx_exists = (
+    SELECT COUNT(*)
+    FROM INFORMATION_SCHEMA.STATISTICS
+    WHERE TABLE_SCHEMA = DATABASE()
+      AND TABLE_NAME   = 'fretes'
+      AND INDEX_NAME   = 'idx_fretes_cliente_produto_data'
+);
+
+SET @sql = IF(
+    @idx_exists = 0,
+    'CREATE INDEX idx_fretes_cliente_produto_data ON fretes (clientes_id, produto_id, data_frete)',
+    'SELECT ''índice idx_fretes_cliente_produto_data já existe'' AS info'
+);
+
+PREPARE stmt FROM @sql;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
+SET @idx_exists = (
+    SELECT COUNT(*)
+    FROM INFORMATION_SCHEMA.STATISTICS
+    WHERE TABLE_SCHEMA = DATABASE()
+      AND TABLE_NAME   = 'fretes'
+      AND INDEX_NAME   = 'idx_fretes_data'
+);
+
+SET @sql = IF(
+    @idx_exists = 0,
+    'CREATE INDEX idx_fretes_data ON fretes (data_frete)',
+    'SELECT ''índice idx_fretes_data já existe'' AS info'
+);
+
+PREPARE stmt FROM @sql;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
+SET @idx_exists = (
+    SELECT COUNT(*)
+    FROM INFORMATION_SCHEMA.STATISTICS
+    WHERE TABLE_SCHEMA = DATABASE()
+      AND TABLE_NAME   = 'pedidos'
+      AND INDEX_NAME   = 'idx_pedidos_data'
+);
+
+SET @sql = IF(
+    @idx_exists = 0,
+    'CREATE INDEX idx_pedidos_data ON pedidos (data_pedido)',
+    'SELECT ''índice idx_pedidos_data já existe'' AS info'
+);
+
+PREPARE stmt FROM @sql;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
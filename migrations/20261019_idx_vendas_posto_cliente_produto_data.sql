@@ -0,0 +1,47 @@
+-- Migration: idx_vendas_posto_cliente_produto_data — índices para os filtros por mês
+-- Scope: os relatórios de Lucro Postos/FIFO filtram vendas_posto por
+-- (cliente_id, produto_id) + intervalo de data_movimento e somam
+-- quantidade_litros, e com a coluna somada no fim o índice cobre a consulta
+-- (não lê a linha). O dashboard filtra só pelo mês -> índice por data.
+-- Os filtros foram reescritos como intervalo semiaberto (utils/periodo_sql.py)
+-- -- YEAR()/MONTH()/DATE() na coluna impediam o uso de qualquer índice.
+-- Substitui 20261018_idx_vendas_posto_cliente_produto_data.sql: ADD INDEX IF
+-- NOT EXISTS não existe no MySQL 8, o ALTER falhava e o runner gravava a
+-- migration como aplicada sem índice nenhum. Cada CREATE INDEX só roda se o
+-- information_schema disser que falta.
+
+SET @idx_exists = (
+    SELECT COUNT(*)
+    FROM INFORMATION_SCHEMA.STATISTICS
+    WHERE TABLE_SCHEMA = DATABASE()
+      AND TABLE_NAME   = 'vendas_posto'
+      AND INDEX_NAME   = 'idx_vp_cliente_produto_data'
+);
+
+SET @sql = IF(
+    @idx_exists = 0,
+    'CREATE INDEX idx_vp_cliente_produto_data ON vendas_posto (cliente_id, produto_id, data_movimento, quantidade_litros)',
+    'SELECT ''índice idx_vp_cliente_produto_data já existe'' AS info'
+);
+
+PREPARE stmt FROM @sql;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
+SET @idx_exists = (
+    SELECT COUNT(*)
+    FROM INFORMATION_SCHEMA.STATISTICS
+    WHERE TABLE_SCHEMA = DATABASE()
+      AND TABLE_NAME   = 'vendas_posto'
+      AND INDEX_NAME   = 'idx_vp_data_produto'
+);
+
+SET @sql = IF(
+    @idx_exists = 0,
+    'CREATE INDEX idx_vp_data_produto ON vendas_posto (data_movimento, produto_id, quantidade_litros)',
+    'SELECT ''índice idx_vp_data_produto já existe'' AS info'
+);
+
+PREPARE stmt FROM @sql;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
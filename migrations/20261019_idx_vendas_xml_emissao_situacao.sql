@@ -0,0 +1,28 @@
+-- Migration: idx_vendas_xml_emissao_situacao — vendas do dia/período
+-- Scope: estoque (tempo real, conciliação, auditoria) e a Onda 1 do dashboard
+-- filtram vendas_xml por intervalo de dh_emissao e situacao <> 'cancelada'.
+-- O intervalo vem primeiro: com situacao na frente, o "diferente de" virava
+-- duas faixas no índice e o intervalo de data só se aplicava dentro de cada
+-- uma. situacao fica no índice para o filtro não precisar ler a linha.
+-- Substitui 20261018_idx_vendas_xml_situacao_emissao.sql: ADD INDEX IF NOT
+-- EXISTS não existe no MySQL 8, o ALTER falhava e o runner gravava a
+-- migration como aplicada sem índice nenhum. Cada CREATE INDEX só roda se o
+-- information_schema disser que falta.
+
+SET @idx_exists = (
+    SELECT COUNT(*)
+    FROM INFORMATION_SCHEMA.STATISTICS
+    WHERE TABLE_SCHEMA = DATABASE()
+      AND TABLE_NAME   = 'vendas_xml'
+      AND INDEX_NAME   = 'idx_vx_emissao_situacao'
+);
+
+SET @sql = IF(
+    @idx_exists = 0,
+    'CREATE INDEX idx_vx_emissao_situacao ON vendas_xml (dh_emissao, situacao)',
+    'SELECT ''índice idx_vx_emissao_situacao já existe'' AS info'
+);
+
+PREPARE stmt FROM @sql;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
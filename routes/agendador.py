@@ -0,0 +1,61 @@
+"""
+Painel do agendador (integrations/agendador.py): jobs registrados com as
+métricas da última rodada, próxima execução, histórico recente e o pedido
+"disparar agora" (vai para a fila; quem roda é o processo do agendador).
+"""
+from flask import Blueprint, jsonify, request
+from flask_login import current_user, login_required
+
+from integrations import agendador
+from utils.db import get_db_connection
+from utils.decorators import admin_required
+
+bp = Blueprint('agendador', __name__, url_prefix='/agendador')
+
+
+def _txt(v):
+    return str(v) if v is not None else None
+
+
+@bp.route('/status')
+@login_required
+@admin_required
+def status():
+    limite = min(request.args.get('limite', 50, type=int) or 50, 500)
+    conn = get_db_connection()
+    cur = conn.cursor(dictionary=True)
+    try:
+        cur.execute(
+            "SELECT job, descricao, agenda, automatico, proxima_execucao, ultima_execucao, "
+            "ultimo_status, ultima_duracao_ms, ultimas_linhas, execucoes, falhas, visto_em "
+            "FROM agendador_jobs ORDER BY job")
+        jobs = cur.fetchall()
+        cur.execute(
+            "SELECT id, job, origem, status, pedido_por, pedido_em, inicio, fim, duracao_ms, "
+            "linhas, detalhe, processo FROM agendador_execucoes ORDER BY id DESC LIMIT %s",
+            (limite,))
+        execucoes = cur.fetchall()
+    finally:
+        cur.close()
+    cur = conn.cursor()
+    try:
+        vivo = agendador.processo_vivo(cur)
+    finally:
+        cur.close()
+        conn.close()
+
+    for linha in jobs + execucoes:
+        for k in ('proxima_execucao', 'ultima_execucao', 'visto_em', 'pedido_em', 'inicio', 'fim'):
+            if k in linha:
+                linha[k] = _txt(linha[k])
+    return jsonify({'processo_no_ar': vivo, 'jobs': jobs, 'execucoes': execucoes})
+
+
+@bp.route('/disparar/<job>', methods=['POST'])
+@login_required
+@admin_required
+def disparar(job):
+    if job not in {j.nome for j in agendador.registro()}:
+        return jsonify({'ok': False, 'erro': 'job desconhecido: %s' % job}), 404
+    pedido, novo = agendador.enfileirar(job, pedido_por=getattr(current_user, 'username', None))
+    return jsonify({'ok': True, 'pedido': pedido, 'novo': novo})
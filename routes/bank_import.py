@@ -1,24 +1,31 @@
+import contextlib
 import csv
+import heapq
 import io
+import itertools
 import logging
 import os
 import re
+import tempfile
 import time
 import datetime as _dt
+import importlib.util
 from collections import Counter, defaultdict
 
-try:
-    import openpyxl
-    from openpyxl.styles import Font, PatternFill, Alignment
-    _OPENPYXL_AVAILABLE = True
-except ImportError:
-    _OPENPYXL_AVAILABLE = False
+# openpyxl só é importado em exportar_contabil (pesa ~75 ms no boot de todo worker).
+_OPENPYXL_AVAILABLE = importlib.util.find_spec('openpyxl') is not None
 
 import mysql.connector
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, Response
+from flask import (Blueprint, render_template, request, redirect, url_for, flash, jsonify, Response,
+                   send_file, stream_with_context)
 from flask_login import login_required, current_user
 from extensions import csrf
-from utils.db import get_db_connection
+from utils import contas_contabeis
+from utils.cnpj_digitos import digitos
+from utils.db import get_db_connection, get_stream_connection
+from utils.dias_uteis import CalendarioUteis
+from utils.regras_conciliacao import indice_para as indice_regras_para
+from utils.schema_registry import garantia
 
 logger = logging.getLogger(__name__)
 
@@ -254,6 +261,7 @@ def _fix_auto_regra_subcategoria():
                 pass
 
 
+@garantia
 def _ensure_descricao_chave():
     """Garante que bank_supplier_mapping está com o schema completo esperado.
 
@@ -272,7 +280,7 @@ def _ensure_descricao_chave():
     if _bsm_descricao_chave_ready:
         return
     if _bsm_descricao_chave_retry_after > time.time():
-        return  # em cooldown; tenta novamente após o período de espera
+        return False  # em cooldown; tenta novamente após o período de espera
     conn = None
     try:
         conn = get_db_connection()
@@ -396,18 +404,20 @@ def _ensure_descricao_chave():
     except Exception:
         logger.warning("_ensure_descricao_chave: não foi possível aplicar schema de bank_supplier_mapping", exc_info=True)
         _bsm_descricao_chave_retry_after = time.time() + _MIGRATION_RETRY_DELAY  # evita retries imediatos, mas permite recuperação
+        return False
     finally:
         if conn:
             conn.close()
 
 
+@garantia
 def _ensure_ld_bank_tx_id():
     """Garante que lancamentos_despesas.bank_transaction_id existe. Idempotente."""
     global _ld_bank_tx_id_ready, _ld_bank_tx_id_retry_after
     if _ld_bank_tx_id_ready:
         return
     if _ld_bank_tx_id_retry_after > time.time():
-        return  # em cooldown
+        return False  # em cooldown
     conn = None
     try:
         conn = get_db_connection()
@@ -429,18 +439,20 @@ def _ensure_ld_bank_tx_id():
     except Exception:
         logger.warning("_ensure_ld_bank_tx_id: não foi possível criar a coluna bank_transaction_id", exc_info=True)
         _ld_bank_tx_id_retry_after = time.time() + _MIGRATION_RETRY_DELAY  # evita retries imediatos, permite recuperação
+        return False
     finally:
         if conn:
             conn.close()
 
 
+@garantia
 def _ensure_bank_accounts_ultima_data():
     """Garante que bank_accounts.ultima_data_importacao existe. Idempotente."""
     global _bank_accounts_ultima_data_ready, _bank_accounts_ultima_data_retry_after
     if _bank_accounts_ultima_data_ready:
         return
     if _bank_accounts_ultima_data_retry_after > time.time():
-        return
+        return False
     conn = None
     try:
         conn = get_db_connection()
@@ -464,18 +476,20 @@ def _ensure_bank_accounts_ultima_data():
     except Exception:
         logger.warning("_ensure_bank_accounts_ultima_data: falha ao criar coluna", exc_info=True)
         _bank_accounts_ultima_data_retry_after = time.time() + _MIGRATION_RETRY_DELAY
+        return False
     finally:
         if conn:
             conn.close()
 
 
+@garantia
 def _ensure_bank_accounts_coligadas():
     """Garante que bank_accounts possui as colunas de conta contábil para coligadas. Idempotente."""
     global _bank_accounts_coligadas_ready, _bank_accounts_coligadas_retry_after
     if _bank_accounts_coligadas_ready:
         return
     if _bank_accounts_coligadas_retry_after > time.time():
-        return
+        return False
     conn = None
     try:
         conn = get_db_connection()
@@ -515,18 +529,20 @@ def _ensure_bank_accounts_coligadas():
     except Exception:
         logger.warning("_ensure_bank_accounts_coligadas: falha ao criar colunas", exc_info=True)
         _bank_accounts_coligadas_retry_after = time.time() + _MIGRATION_RETRY_DELAY
+        return False
     finally:
         if conn:
             conn.close()
 
 
+@garantia
 def _ensure_bank_account_coligadas_table():
     """Garante que a tabela bank_account_coligadas existe. Idempotente."""
     global _bank_account_coligadas_table_ready, _bank_account_coligadas_table_retry_after
     if _bank_account_coligadas_table_ready:
         return
     if _bank_account_coligadas_table_retry_after > time.time():
-        return
+        return False
     conn = None
     try:
         conn = get_db_connection()
@@ -567,18 +583,20 @@ def _ensure_bank_account_coligadas_table():
             "_ensure_bank_account_coligadas_table: falha ao criar tabela", exc_info=True
         )
         _bank_account_coligadas_table_retry_after = time.time() + _MIGRATION_RETRY_DELAY
+        return False
     finally:
         if conn:
             conn.close()
 
 
+@garantia
 def _ensure_bt_conta_origem_id():
     """Garante que bank_transactions.conta_origem_id existe. Idempotente."""
     global _bt_conta_origem_id_ready, _bt_conta_origem_id_retry_after
     if _bt_conta_origem_id_ready:
         return
     if _bt_conta_origem_id_retry_after > time.time():
-        return
+        return False
     conn = None
     try:
         conn = get_db_connection()
@@ -601,18 +619,20 @@ def _ensure_bt_conta_origem_id():
     except Exception:
         logger.warning("_ensure_bt_conta_origem_id: falha ao criar coluna", exc_info=True)
         _bt_conta_origem_id_retry_after = time.time() + _MIGRATION_RETRY_DELAY
+        return False
     finally:
         if conn:
             conn.close()
 
 
+@garantia
 def _ensure_bt_conta_destino_id():
     """Garante que bank_transactions.conta_destino_id existe. Idempotente."""
     global _bt_conta_destino_id_ready, _bt_conta_destino_id_retry_after
     if _bt_conta_destino_id_ready:
         return
     if _bt_conta_destino_id_retry_after > time.time():
-        return
+        return False
     conn = None
     try:
         conn = get_db_connection()
@@ -636,6 +656,7 @@ def _ensure_bt_conta_destino_id():
     except Exception:
         logger.warning("_ensure_bt_conta_destino_id: falha ao criar coluna", exc_info=True)
         _bt_conta_destino_id_retry_after = time.time() + _MIGRATION_RETRY_DELAY
+        return False
     finally:
         if conn:
             conn.close()
@@ -917,12 +938,17 @@ def _save_transactions(cursor, conn, account_id, transactions):
                     time.sleep(0.3 * (attempt + 1))
                     continue
                 raise
+    # Ids das linhas recém-inseridas: as auto-conciliações abaixo rodam só
+    # sobre elas (modo incremental), e não sobre todo o histórico da conta —
+    # o custo acompanha o tamanho do arquivo, não a idade da conta. A
+    # reavaliação completa fica com o botão /api/auto-reconcile.
+    novos_ids = _ids_por_hash(cursor, [r[1] for r in rows])
     # 4. Auto-conciliação imediata por regras de descrição (para os que ficaram pendentes)
-    _auto_conciliar_por_regras(cursor, conn, account_id)
+    _auto_conciliar_por_regras(cursor, conn, account_id, tx_ids=novos_ids)
     # 5. Auto-conciliação de despesas por CNPJ (cria lancamentos_despesas automaticamente)
-    _auto_conciliar_despesas_por_cnpj(cursor, conn, account_id, mapping)
+    _auto_conciliar_despesas_por_cnpj(cursor, conn, account_id, mapping, tx_ids=novos_ids)
     # 6. Auto-conciliação de créditos EFI por charge_id (Recebimento de cobrança: XXXXXXXXX)
-    _auto_conciliar_cobrancas(cursor, conn, account_id)
+    _auto_conciliar_cobrancas(cursor, conn, account_id, tx_ids=novos_ids)
 
     # Enriquece duplicados_lista com informações do registro existente (id, status)
     if duplicados_lista:
@@ -943,6 +969,80 @@ def _save_transactions(cursor, conn, account_id, transactions):
     return inseridos, duplicados, duplicados_lista
 
 
+_IN_LOTE = 1000  # tamanho máximo de cada lista IN (...) nas buscas por id/hash
+
+
+def _ids_por_hash(cursor, hashes):
+    """Ids de bank_transactions para os *hashes* (hash_dedup é UNIQUE)."""
+    ids = []
+    for i in range(0, len(hashes), _IN_LOTE):
+        lote = hashes[i:i + _IN_LOTE]
+        ph = ','.join(['%s'] * len(lote))
+        cursor.execute(
+            f'SELECT id FROM bank_transactions WHERE hash_dedup IN ({ph})',
+            lote,
+        )
+        ids.extend(r['id'] for r in cursor.fetchall())
+    return ids
+
+
+def _select_por_ids(cursor, sql, params, tx_ids, coluna='id'):
+    """Executa *sql* (que termina num WHERE aberto) restrito a *tx_ids*, em lotes.
+
+    *tx_ids* None = sem restrição (modo completo). Devolve todas as linhas.
+    """
+    if tx_ids is None:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+    linhas = []
+    tx_ids = list(tx_ids)
+    for i in range(0, len(tx_ids), _IN_LOTE):
+        lote = tx_ids[i:i + _IN_LOTE]
+        ph = ','.join(['%s'] * len(lote))
+        cursor.execute(f'{sql} AND {coluna} IN ({ph})', list(params) + lote)
+        linhas.extend(cursor.fetchall())
+    return linhas
+
+
+# Tamanho do lote de gravação do OFX em streaming: cada lote faz a sua
+# checagem de duplicatas, o seu executemany e a sua auto-conciliação.
+_OFX_LOTE = 2000
+# Quantas duplicatas detalhadas voltam para a tela (a contagem é sempre total);
+# um extrato de 24 meses reimportado não pode virar uma lista de 500 mil itens.
+_DUPLICADOS_LISTA_MAX = 1000
+
+
+def _save_transactions_em_lotes(cursor, conn, account_id, transactions, tamanho=_OFX_LOTE):
+    """
+    Grava um iterável de transações (ex.: `iter_transactions()`) em lotes de
+    *tamanho*, chamando `_save_transactions` para cada lote. A memória fica no
+    tamanho do lote, qualquer que seja o tamanho do arquivo.
+
+    Retorna (inseridos, duplicados, duplicados_lista) como `_save_transactions`.
+    """
+    inseridos = duplicados = 0
+    duplicados_lista = []
+    lote = []
+
+    def _grava():
+        nonlocal inseridos, duplicados
+        ins, dup, dup_lista = _save_transactions(cursor, conn, account_id, lote)
+        inseridos += ins
+        duplicados += dup
+        falta = _DUPLICADOS_LISTA_MAX - len(duplicados_lista)
+        if falta > 0:
+            duplicados_lista.extend(dup_lista[:falta])
+        lote.clear()
+
+    for tx in transactions:
+        lote.append(tx)
+        if len(lote) >= tamanho:
+            _grava()
+    if lote:
+        _grava()
+    return inseridos, duplicados, duplicados_lista
+
+
 def _get_or_create_forma_compensacao_cobranca(cursor, conn):
     """Retorna o id de formas_recebimento para 'Compensação Cobrança', criando se não existir."""
     try:
@@ -962,7 +1062,7 @@ def _get_or_create_forma_compensacao_cobranca(cursor, conn):
         return None
 
 
-def _auto_conciliar_cobrancas(cursor, conn, account_id=None):
+def _auto_conciliar_cobrancas(cursor, conn, account_id=None, tx_ids=None):
     """
     Auto-concilia créditos do banco EFI com cobranças emitidas.
 
@@ -976,6 +1076,9 @@ def _auto_conciliar_cobrancas(cursor, conn, account_id=None):
     3. Marca a cobrança como paga (status='pago', pago_via_provedor=1).
     4. Marca a transação bancária como conciliada com forma 'Compensação Cobrança'.
 
+    *tx_ids* (opcional) restringe a busca a essas transações — é o modo
+    incremental usado após um upload de OFX.
+
     Retorna o número de pares conciliados.
     """
     import re as _re
@@ -987,23 +1090,28 @@ def _auto_conciliar_cobrancas(cursor, conn, account_id=None):
         _re.IGNORECASE,
     )
 
+    if tx_ids is not None and not tx_ids:
+        return 0
+
     forma_id = _get_or_create_forma_compensacao_cobranca(cursor, conn)
 
     # Busca créditos pendentes (ou já conciliados por outras regras mas sem cobranca linkada)
     if account_id:
-        cursor.execute(
+        pendentes = _select_por_ids(
+            cursor,
             """SELECT id, descricao, valor, data_transacao
                FROM bank_transactions
                WHERE account_id = %s AND tipo = 'CREDIT' AND status = 'pendente'""",
-            (account_id,),
+            (account_id,), tx_ids,
         )
     else:
-        cursor.execute(
+        pendentes = _select_por_ids(
+            cursor,
             """SELECT id, descricao, valor, data_transacao
                FROM bank_transactions
-               WHERE tipo = 'CREDIT' AND status = 'pendente'"""
+               WHERE tipo = 'CREDIT' AND status = 'pendente'""",
+            (), tx_ids,
         )
-    pendentes = cursor.fetchall()
     if not pendentes:
         return 0
 
@@ -1079,15 +1187,16 @@ def _update_bank_tx_conciliada(cursor, tx_id, forma_id, agora):
     )
 
 
-def _auto_conciliar_despesas_por_cnpj(cursor, conn, account_id, mapping):
+def _auto_conciliar_despesas_por_cnpj(cursor, conn, account_id, mapping, tx_ids=None):
     """
     Cria lancamentos_despesas automaticamente para débitos pendentes cujo CNPJ
     tem mapeamento de despesa integral (titulo_id+categoria_id) em bank_supplier_mapping.
     Débitos divididos (split) nunca são auto-conciliados — ficam para o usuário.
+    *tx_ids* (opcional) restringe a busca a essas transações.
     """
     # mapping é indexado por (cnpj_cpf, descricao_chave); filtra os que têm despesa
     despesa_mappings = {key: m for key, m in mapping.items() if m.get('titulo_id')}
-    if not despesa_mappings:
+    if not despesa_mappings or (tx_ids is not None and not tx_ids):
         return 0
 
     # Busca cliente_id da conta
@@ -1097,13 +1206,13 @@ def _auto_conciliar_despesas_por_cnpj(cursor, conn, account_id, mapping):
 
     cnpj_list = list({key[0] for key in despesa_mappings.keys()})
     ph = ','.join(['%s'] * len(cnpj_list))
-    cursor.execute(
+    pendentes = _select_por_ids(
+        cursor,
         f"""SELECT id, data_transacao, descricao, cnpj_cpf, valor
             FROM bank_transactions
             WHERE account_id=%s AND tipo='DEBIT' AND status='pendente' AND cnpj_cpf IN ({ph})""",
-        [account_id] + cnpj_list,
+        [account_id] + cnpj_list, tx_ids,
     )
-    pendentes = cursor.fetchall()
     if not pendentes:
         return 0
 
@@ -1136,9 +1245,17 @@ def _auto_conciliar_despesas_por_cnpj(cursor, conn, account_id, mapping):
     return count
 
 
-def _auto_conciliar_por_regras(cursor, conn, account_id=None):
+def _auto_conciliar_por_regras(cursor, conn, account_id=None, tx_ids=None):
     """
     Aplica bank_conciliacao_regras às transações pendentes do account_id (ou todas).
+
+    Modos:
+      - incremental: *tx_ids* informado → só essas transações são avaliadas
+        (upload de OFX passa os ids recém-inseridos; edição de regra passa as
+        transações que a regra pode casar). Lista vazia não faz nada.
+      - completo: *tx_ids* None → todo o histórico pendente/auto da conta (ou
+        de todas as contas); é o botão de auto-conciliação do admin.
+
     Suporta:
       - Match simples (padrao_descricao contém ou é exato)
       - Match composto (padrao_descricao + padrao_secundario: ambos devem estar na descrição)
@@ -1149,6 +1266,8 @@ def _auto_conciliar_por_regras(cursor, conn, account_id=None):
     Performance: todo o matching é feito em Python (memória); as escritas no BD são
     feitas em lote com executemany() para evitar timeouts quando há muitas transações.
     """
+    if tx_ids is not None and not tx_ids:
+        return 0
     # Carrega regras ativas ordenadas por especificidade:
     # 1. Regras vinculadas a uma conta específica (account_id) antes das genéricas
     # 2. Regras com padrão secundário (mais específicas) antes das que só têm padrão principal
@@ -1167,27 +1286,17 @@ def _auto_conciliar_por_regras(cursor, conn, account_id=None):
         return 0
 
     # Busca transações ainda pendentes com dados da conta
+    sql = """SELECT bt.id, bt.descricao, bt.tipo, bt.cnpj_cpf,
+                    bt.data_transacao, bt.valor, bt.account_id,
+                    ba.cliente_id AS conta_cliente_id
+             FROM bank_transactions bt
+             INNER JOIN bank_accounts ba ON ba.id = bt.account_id
+             WHERE (bt.status='pendente' OR (bt.status='conciliado' AND bt.conciliado_por='auto'))"""
+    params = ()
     if account_id:
-        cursor.execute(
-            """SELECT bt.id, bt.descricao, bt.tipo, bt.cnpj_cpf,
-                      bt.data_transacao, bt.valor, bt.account_id,
-                      ba.cliente_id AS conta_cliente_id
-               FROM bank_transactions bt
-               INNER JOIN bank_accounts ba ON ba.id = bt.account_id
-               WHERE (bt.status='pendente' OR (bt.status='conciliado' AND bt.conciliado_por='auto'))
-                 AND bt.account_id=%s""",
-            (account_id,),
-        )
-    else:
-        cursor.execute(
-            """SELECT bt.id, bt.descricao, bt.tipo, bt.cnpj_cpf,
-                      bt.data_transacao, bt.valor, bt.account_id,
-                      ba.cliente_id AS conta_cliente_id
-               FROM bank_transactions bt
-               INNER JOIN bank_accounts ba ON ba.id = bt.account_id
-               WHERE bt.status='pendente' OR (bt.status='conciliado' AND bt.conciliado_por='auto')"""
-        )
-    pendentes = cursor.fetchall()
+        sql += " AND bt.account_id=%s"
+        params = (account_id,)
+    pendentes = _select_por_ids(cursor, sql, params, tx_ids, coluna='bt.id')
     if not pendentes:
         logger.info("_auto_conciliar_por_regras: nenhuma transação pendente encontrada (account_id=%s)", account_id)
         return 0
@@ -1207,58 +1316,41 @@ def _auto_conciliar_por_regras(cursor, conn, account_id=None):
     # rule_hits: contador de quantas vezes cada regra foi aplicada
     rule_hits: Counter = Counter()
 
+    # Índice compilado das regras (Aho-Corasick + exatas por conta/tipo),
+    # reaproveitado entre chamadas enquanto o conjunto de regras não mudar.
+    indice = indice_regras_para(regras)
+
     for tx in pendentes:
-        descricao = (tx.get('descricao') or '').upper()
         tipo = tx.get('tipo') or ''
-        for regra in regras:
-            # Filtra por conta bancária: se a regra for específica para uma conta,
-            # só aplica a transações dessa conta
-            regra_account_id = regra.get('account_id')
-            if regra_account_id and int(regra_account_id) != int(tx['account_id']):
-                continue
-            # Filtra por tipo de transação
-            tipo_regra = regra.get('tipo_transacao', 'AMBOS')
-            if tipo_regra != 'AMBOS' and tipo_regra != tipo:
-                continue
-            # Match principal
-            padrao = (regra.get('padrao_descricao') or '').upper()
-            tipo_match = regra.get('tipo_match', 'contem')
-            if tipo_match == 'exato':
-                match = descricao == padrao
-            else:
-                match = padrao in descricao
-            if not match:
-                continue
-            # Match secundário (composto): ex: "LIQ.COBRANCA SIMPLES" + "TRANSPORTES TREMEA"
-            padrao2 = (regra.get('padrao_secundario') or '').upper()
-            if padrao2 and padrao2 not in descricao:
-                continue
-
-            # Determina o que vincular
-            forma_id     = regra.get('forma_recebimento_id')
-            forn_id      = regra.get('fornecedor_id')
-            titulo_id       = regra.get('titulo_id')
-            categoria_id    = regra.get('categoria_id')
-            subcategoria_id = regra.get('subcategoria_id')
-
-            if titulo_id and categoria_id and tipo == 'DEBIT':
-                # Regra de despesa → acumula INSERT lancamentos_despesas
-                conta_cliente_id = tx.get('conta_cliente_id')
-                batch_despesa_insert.append((
-                    tx['data_transacao'],
-                    conta_cliente_id,
-                    titulo_id, categoria_id, subcategoria_id,
-                    tx['valor'],
-                    (tx.get('descricao') or '')[:255],
-                    tx.get('descricao') or '',
-                    tx['id'],
-                ))
-                batch_despesa_update.append((agora, tx['id']))
-            else:
-                batch_simples.append((forma_id, forn_id, agora, tx['id']))
+        pos = indice.primeira(tx.get('descricao'), tipo, tx['account_id'])
+        if pos is None:
+            continue
+        regra = regras[pos]  # primeira regra que bate
+
+        # Determina o que vincular
+        forma_id     = regra.get('forma_recebimento_id')
+        forn_id      = regra.get('fornecedor_id')
+        titulo_id       = regra.get('titulo_id')
+        categoria_id    = regra.get('categoria_id')
+        subcategoria_id = regra.get('subcategoria_id')
+
+        if titulo_id and categoria_id and tipo == 'DEBIT':
+            # Regra de despesa → acumula INSERT lancamentos_despesas
+            conta_cliente_id = tx.get('conta_cliente_id')
+            batch_despesa_insert.append((
+                tx['data_transacao'],
+                conta_cliente_id,
+                titulo_id, categoria_id, subcategoria_id,
+                tx['valor'],
+                (tx.get('descricao') or '')[:255],
+                tx.get('descricao') or '',
+                tx['id'],
+            ))
+            batch_despesa_update.append((agora, tx['id']))
+        else:
+            batch_simples.append((forma_id, forn_id, agora, tx['id']))
 
-            rule_hits[regra['id']] += 1
-            break  # primeira regra que bate
+        rule_hits[regra['id']] += 1
 
     aplicadas = len(batch_simples) + len(batch_despesa_insert)
     if not aplicadas:
@@ -1414,8 +1506,12 @@ def upload():
 
     nome_arquivo = os.path.basename(arquivo.filename)
 
+    # Parse em streaming direto do upload: o arquivo não é lido inteiro para a
+    # memória (extratos de 24 meses passam de 50 MB).
+    from integrations.ofx_parser import iter_transactions
     try:
-        content = arquivo.read().decode('latin-1', errors='replace')
+        transactions = iter_transactions(arquivo.stream)
+        primeira = next(transactions, None)
     except Exception as exc:
         logger.warning("upload: erro ao ler arquivo OFX: %s", exc)
         if wants_json:
@@ -1423,11 +1519,7 @@ def upload():
         flash(f'Erro ao ler arquivo: {exc}', 'danger')
         return redirect(url_for('bank_import.index'))
 
-    from integrations.ofx_parser import OFXParser
-    parser = OFXParser(content)
-    transactions = parser.get_transactions()
-
-    if not transactions:
+    if primeira is None:
         if wants_json:
             return jsonify({'success': False, 'message': 'Nenhuma transação encontrada no arquivo OFX.'}), 422
         flash('Nenhuma transação encontrada no arquivo OFX.', 'warning')
@@ -1450,7 +1542,9 @@ def upload():
             return redirect(url_for('bank_import.index'))
 
         _ensure_descricao_chave()
-        inseridos, duplicados, duplicados_lista = _save_transactions(cursor, conn, account_id, transactions)
+        inseridos, duplicados, duplicados_lista = _save_transactions_em_lotes(
+            cursor, conn, account_id, itertools.chain([primeira], transactions)
+        )
 
         # Atualiza a data do último extrato importado para esta conta
         _atualizar_ultima_data_importacao(cursor, conn, account_id, data_arquivo)
@@ -2846,110 +2940,86 @@ def relatorio_exportar_csv():
     )
 
 
-@bp.route('/exportar-contabil')
-@login_required
-def exportar_contabil():
-    """Exporta lançamentos bancários no formato contábil (Excel).
+# ---------------------------------------------------------------------------
+# Exportação contábil
+#
+# Sai em streaming, com memória constante qualquer que seja o período: cada
+# fonte (transações conciliadas, vendas de cartão, taxas de cartão) lê de um
+# cursor sem buffer na sua própria conexão, já em ordem de data, e
+# heapq.merge intercala as três -- em vez de juntar tudo numa lista e
+# ordenar. O CSV vai para o navegador à medida que as linhas chegam; o Excel
+# usa o modo write-only do openpyxl (as linhas vão para um arquivo temporário,
+# não para objetos Cell na memória).
+# ---------------------------------------------------------------------------
 
-    Colunas: DATA / DESCRIÇÃO / VALOR / Nº CONTA CRÉDITO / DESCRIÇÃO CONTA CRÉDITO /
-             Nº CONTA DÉBITO / DESCRIÇÃO CONTA DÉBITO
+_CONTABIL_CABECALHO = ['DATA', 'DESCRIÇÃO', 'VALOR',
+                       'Nº CONTA CRÉDITO', 'DESCRIÇÃO CONTA CRÉDITO',
+                       'Nº CONTA DÉBITO',  'DESCRIÇÃO CONTA DÉBITO']
+_CONTABIL_LARGURAS = [12, 55, 14, 18, 32, 18, 32]
+_CONTABIL_LOTE = 2000               # linhas por fetchmany nos cursores sem buffer
+_CONTABIL_CSV_PEDACO = 64 * 1024    # bytes por pedaço do CSV em streaming
+# O servidor desiste de um resultado que o cliente não lê por net_write_timeout
+# (60 s por padrão); com três cursores abertos e um download lento, um deles
+# pode ficar parado esse tempo todo esperando a vez no merge.
+_CONTABIL_NET_WRITE_TIMEOUT = 600
+
+
+@contextlib.contextmanager
+def _conexao_stream():
+    """Conexão própria (get_stream_connection) para um cursor sem buffer."""
+    conn = get_stream_connection()
+    try:
+        try:
+            c = conn.cursor()
+            c.execute('SET SESSION net_write_timeout = %s' % int(_CONTABIL_NET_WRITE_TIMEOUT))
+            c.close()
+        except mysql.connector.Error:
+            logger.warning("exportar_contabil: não foi possível ajustar net_write_timeout", exc_info=True)
+        yield conn
+    finally:
+        conn.close()
 
-    Regras de CONTA CRÉDITO / CONTA DÉBITO:
-    - DEBIT  (saída):  CONTA CRÉDITO = plano_contas da conta bancária
-                       CONTA DÉBITO  = conta coligada da empresa destino (débito)
-                                       ou conta contábil da categoria de despesa
-    - CREDIT (entrada): CONTA DÉBITO  = plano_contas da conta bancária
-                        CONTA CRÉDITO = conta coligada da empresa origem (crédito)
-                                        ou conta contábil da forma de recebimento
-    Per-company coligada config fetched from bank_account_coligadas table.
-    """
-    _ensure_bank_accounts_coligadas()
-    _ensure_bank_account_coligadas_table()
-    _ensure_bt_conta_origem_id()
-    _ensure_bt_conta_destino_id()
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
 
-    account_id = request.args.get('account_id', '')
-    empresa_id = request.args.get('empresa_id', '')
-    data_ini   = request.args.get('data_ini', '')
-    data_fim   = request.args.get('data_fim', '')
+def _ler_em_lotes(conn, sql, params):
+    """Linhas de `sql` num cursor sem buffer, _CONTABIL_LOTE por ida ao socket.
 
-    where_parts = ['bt.status = %s',
-                   # Exclui as linhas espelho CREDIT criadas automaticamente em transferências;
-                   # a linha DEBIT já contém toda a informação contábil (débito+crédito).
-                   "NOT (bt.tipo = 'CREDIT' AND COALESCE(bt.tipo_conciliacao,'') = 'transferencia')"]
-    params      = ['conciliado']
+    Se o gerador for fechado antes do fim (download cancelado, erro mais
+    adiante), o resto do resultado é descartado para a conexão voltar limpa
+    ao pool.
+    """
+    cursor = conn.cursor(dictionary=True, buffered=False)
+    completo = False
+    try:
+        cursor.execute(sql, params)
+        while True:
+            lote = cursor.fetchmany(_CONTABIL_LOTE)
+            if not lote:
+                break
+            yield from lote
+        completo = True
+    finally:
+        if not completo:
+            try:
+                conn.consume_results()
+            except Exception:
+                pass
+        try:
+            cursor.close()
+        except mysql.connector.Error:
+            pass
 
-    if account_id:
-        where_parts.append('bt.account_id = %s')
-        params.append(account_id)
-    if empresa_id:
-        where_parts.append('ba.cliente_id = %s')
-        params.append(empresa_id)
-    if data_ini:
-        where_parts.append('bt.data_transacao >= %s')
-        params.append(data_ini)
-    if data_fim:
-        where_parts.append('bt.data_transacao <= %s')
-        params.append(data_fim)
 
-    where_sql = 'WHERE ' + ' AND '.join(where_parts)
+def _contabil_data(r):
+    """Chave de ordenação das linhas da exportação: a data, qualquer que seja a fonte."""
+    d = r.get('data_transacao') or r.get('data_venda') or r.get('data_recebimento')
+    return d if d else _dt.date.min
 
-    cursor.execute(
-        """SELECT
-               bt.id,
-               bt.account_id,
-               bt.data_transacao,
-               bt.tipo,
-               bt.valor,
-               bt.descricao,
-               bt.cnpj_cpf,
-               bt.tipo_conciliacao,
-               bt.forma_recebimento_id,
-               bt.fornecedor_id,
-               COALESCE(bt.conta_destino_id, bt_mirror.account_id) AS conta_destino_id,
-               -- Conta bancária
-               ba.apelido  AS conta_apelido,
-               ba.banco_nome,
-               ba.cliente_id AS banco_cliente_id,
-               pc_ba.codigo AS conta_banco_codigo,
-               pc_ba.nome   AS conta_banco_nome,
-               -- Empresa destino (para débitos/transferências)
-               ba_dest.cliente_id AS destino_cliente_id,
-               ba_dest.banco_nome AS conta_destino_banco_nome,
-               pc_ba_dest.codigo  AS conta_destino_codigo,
-               pc_ba_dest.nome    AS conta_destino_nome,
-               -- Empresa origem (para créditos/transferências via conta_origem_id)
-               ba_orig.cliente_id AS origem_cliente_id,
-               pc_ba_orig.codigo  AS conta_origem_codigo,
-               pc_ba_orig.nome    AS conta_origem_nome,
-               -- Empresa
-               c.razao_social AS empresa_nome,
-               -- Forma de recebimento e seu plano de contas (créditos normais)
-               fr.nome AS forma_recebimento_nome,
-               pc_fr.codigo AS conta_fr_codigo,
-               pc_fr.nome   AS conta_fr_nome
-           FROM bank_transactions bt
-           INNER JOIN bank_accounts ba ON ba.id = bt.account_id
-           LEFT JOIN plano_contas_contas pc_ba ON pc_ba.id = ba.plano_contas_conta_id
-           LEFT JOIN clientes c ON c.id = ba.cliente_id
-           LEFT JOIN formas_recebimento fr ON fr.id = bt.forma_recebimento_id
-           LEFT JOIN formas_recebimento_empresas fre
-               ON fre.forma_recebimento_id = fr.id AND fre.cliente_id = ba.cliente_id
-           LEFT JOIN plano_contas_contas pc_fr ON pc_fr.id = fre.conta_contabil_id
-           LEFT JOIN bank_transactions bt_mirror ON bt_mirror.hash_dedup = CONCAT('TRANSFER_', bt.id)
-           LEFT JOIN bank_accounts ba_dest ON ba_dest.id = COALESCE(bt.conta_destino_id, bt_mirror.account_id)
-           LEFT JOIN plano_contas_contas pc_ba_dest ON pc_ba_dest.id = ba_dest.plano_contas_conta_id
-           LEFT JOIN bank_accounts ba_orig ON ba_orig.id = bt.conta_origem_id
-           LEFT JOIN plano_contas_contas pc_ba_orig ON pc_ba_orig.id = ba_orig.plano_contas_conta_id
-           """
-        + where_sql
-        + ' ORDER BY bt.data_transacao ASC, bt.id ASC',
-        params,
-    )
-    rows = cursor.fetchall()
 
+def _contabil_mapas(cursor):
+    """Configurações de contas contábeis usadas pelo Resolvedor
+    (utils/contas_contabeis) e pelas linhas de cartão. Pequenas (uma linha
+    por conta/categoria/fornecedor/bandeira configurada); guardadas por
+    worker até a próxima gravação da configuração."""
     # Load ALL per-company coligada configs for these bank accounts into a dict:
     # {(bank_account_id, coligada_cliente_id): {debito: (cod, nome), credito: (cod, nome)}}
     try:
@@ -2972,25 +3042,20 @@ def exportar_contabil():
         logger.warning("exportar_contabil: falha ao carregar bank_account_coligadas", exc_info=True)
         coligada_map = {}
 
-    # Fetch categoria/subcategoria accounting codes for despesas
-    # Build a mapping: bank_transaction_id → conta_contabil code
+    # Contas das categorias de despesa: (categoria_id, cliente_id) → (codigo, nome).
+    # A transação traz os pares dos seus lançamentos em despesa_categorias.
     cursor.execute(
-        """SELECT ld.bank_transaction_id,
+        """SELECT cdc.categoria_id, cdc.cliente_id,
                   pc.codigo AS conta_codigo,
                   pc.nome   AS conta_nome
-           FROM lancamentos_despesas ld
-           LEFT JOIN categoria_despesa_contas cdc
-               ON cdc.categoria_id = ld.categoria_id AND cdc.cliente_id = ld.cliente_id
-           LEFT JOIN plano_contas_contas pc ON pc.id = cdc.conta_contabil_id
-           WHERE ld.bank_transaction_id IS NOT NULL
-             AND pc.id IS NOT NULL"""
+           FROM categoria_despesa_contas cdc
+           JOIN plano_contas_contas pc ON pc.id = cdc.conta_contabil_id"""
     )
-    despesa_conta_map = {}
+    categoria_conta_map = {}
     for r in cursor.fetchall():
-        if r['bank_transaction_id'] and r['bank_transaction_id'] not in despesa_conta_map:
-            despesa_conta_map[r['bank_transaction_id']] = (
-                r['conta_codigo'] or '', r['conta_nome'] or ''
-            )
+        categoria_conta_map[(r['categoria_id'], r['cliente_id'])] = (
+            r['conta_codigo'] or '', r['conta_nome'] or ''
+        )
 
     # Fetch supplier accounting codes: (fornecedor_id, cliente_id) → (codigo, nome)
     fornecedor_conta_map = {}
@@ -3009,19 +3074,19 @@ def exportar_contabil():
     except Exception:
         logger.warning("exportar_contabil: falha ao carregar fornecedor_conta_map", exc_info=True)
 
-    # Fetch CNPJ-based accounting codes: (cnpj, cliente_id) → (codigo, nome)
+    # Fetch CNPJ-based accounting codes: (cnpj digits, cliente_id) → (codigo, nome)
     # Used as a fallback when fornecedor_id is not set on the transaction.
     cnpj_conta_map = {}
     try:
         cursor.execute(
-            """SELECT REPLACE(REPLACE(REPLACE(REPLACE(f.cnpj, '.', ''), '/', ''), '-', ''), ' ', '') AS cnpj_digits,
+            """SELECT __F__ AS cnpj_digits,
                       fe.cliente_id,
                       pc.codigo AS conta_codigo, pc.nome AS conta_nome
                FROM fornecedores f
                JOIN fornecedor_empresas fe ON fe.fornecedor_id = f.id
                JOIN plano_contas_contas pc ON pc.id = fe.conta_contabil_id
                WHERE fe.conta_contabil_id IS NOT NULL
-                 AND f.cnpj IS NOT NULL AND f.cnpj <> ''"""
+                 AND __F__ <> ''""".replace('__F__', digitos('fornecedores', 'f'))
         )
         for r in cursor.fetchall():
             cnpj_d = r['cnpj_digits'] or ''
@@ -3073,45 +3138,115 @@ def exportar_contabil():
     except Exception:
         logger.warning("exportar_contabil: falha ao carregar cartao_conta_map", exc_info=True)
 
-    # Fetch card sales grouped by (date, bandeira, empresa) for the selected period/empresa
-    card_sale_rows = []
-    if data_ini and data_fim and cartao_conta_map:
-        try:
-            cs_where = ["lc.data BETWEEN %s AND %s", "lcc.bandeira_cartao_id IS NOT NULL"]
-            cs_params = [data_ini, data_fim]
-            # Determine empresa filter: explicit empresa_id, or derive from account_id
-            _cs_empresa_id = empresa_id
-            if not _cs_empresa_id and account_id:
-                cursor.execute("SELECT cliente_id FROM bank_accounts WHERE id = %s", (account_id,))
-                _row_ba = cursor.fetchone()
-                if _row_ba:
-                    _cs_empresa_id = _row_ba['cliente_id']
-            if _cs_empresa_id:
-                cs_where.append("lc.cliente_id = %s")
-                cs_params.append(_cs_empresa_id)
-            cursor.execute(
-                f"""SELECT lc.data AS data_venda,
-                           lc.cliente_id,
-                           COALESCE(c.nome_fantasia, c.razao_social) AS empresa_nome,
-                           lcc.bandeira_cartao_id AS bandeira_id,
-                           bc.nome AS bandeira_nome,
-                           bc.tipo AS tipo_cartao,
-                           SUM(lcc.valor) AS total_venda
-                      FROM lancamentos_caixa_comprovacao lcc
-                      JOIN lancamentos_caixa lc ON lc.id = lcc.lancamento_caixa_id
-                      JOIN bandeiras_cartao bc ON bc.id = lcc.bandeira_cartao_id
-                      JOIN clientes c ON c.id = lc.cliente_id
-                     WHERE {' AND '.join(cs_where)}
-                     GROUP BY lc.data, lc.cliente_id, lcc.bandeira_cartao_id
-                     ORDER BY lc.data, lc.cliente_id, bc.tipo, bc.nome""",
-                cs_params,
-            )
-            for r in cursor.fetchall():
-                key = (r['bandeira_id'], r['cliente_id'])
-                contas = cartao_conta_map.get(key)
+    return {
+        'coligada':   coligada_map,
+        'categoria':  categoria_conta_map,
+        'fornecedor': fornecedor_conta_map,
+        'cnpj':       cnpj_conta_map,
+        'troco_pix':  troco_pix_conta_map,
+        'cartao':     cartao_conta_map,
+    }
+
+
+_SQL_CONTABIL_TRANSACOES = """SELECT
+       bt.id,
+       bt.account_id,
+       bt.data_transacao,
+       bt.tipo,
+       bt.valor,
+       bt.descricao,
+       bt.cnpj_cpf,
+       __BT_DIGITOS__ AS cnpj_cpf_digitos,
+       bt.tipo_conciliacao,
+       bt.forma_recebimento_id,
+       bt.fornecedor_id,
+       COALESCE(bt.conta_destino_id, bt_mirror.account_id) AS conta_destino_id,
+       -- Lançamentos de despesa vinculados: 'categoria:empresa,...'
+       (SELECT GROUP_CONCAT(ld.categoria_id, ':', ld.cliente_id ORDER BY ld.id)
+          FROM lancamentos_despesas ld
+         WHERE ld.bank_transaction_id = bt.id) AS despesa_categorias,
+       -- Conta bancária
+       ba.apelido  AS conta_apelido,
+       ba.banco_nome,
+       ba.cliente_id AS banco_cliente_id,
+       pc_ba.codigo AS conta_banco_codigo,
+       pc_ba.nome   AS conta_banco_nome,
+       -- Empresa destino (para débitos/transferências)
+       ba_dest.cliente_id AS destino_cliente_id,
+       ba_dest.banco_nome AS conta_destino_banco_nome,
+       pc_ba_dest.codigo  AS conta_destino_codigo,
+       pc_ba_dest.nome    AS conta_destino_nome,
+       -- Empresa origem (para créditos/transferências via conta_origem_id)
+       ba_orig.cliente_id AS origem_cliente_id,
+       pc_ba_orig.codigo  AS conta_origem_codigo,
+       pc_ba_orig.nome    AS conta_origem_nome,
+       -- Empresa
+       c.razao_social AS empresa_nome,
+       -- Forma de recebimento e seu plano de contas (créditos normais)
+       fr.nome AS forma_recebimento_nome,
+       pc_fr.codigo AS conta_fr_codigo,
+       pc_fr.nome   AS conta_fr_nome
+   FROM bank_transactions bt
+   INNER JOIN bank_accounts ba ON ba.id = bt.account_id
+   LEFT JOIN plano_contas_contas pc_ba ON pc_ba.id = ba.plano_contas_conta_id
+   LEFT JOIN clientes c ON c.id = ba.cliente_id
+   LEFT JOIN formas_recebimento fr ON fr.id = bt.forma_recebimento_id
+   LEFT JOIN formas_recebimento_empresas fre
+       ON fre.forma_recebimento_id = fr.id AND fre.cliente_id = ba.cliente_id
+   LEFT JOIN plano_contas_contas pc_fr ON pc_fr.id = fre.conta_contabil_id
+   LEFT JOIN bank_transactions bt_mirror ON bt_mirror.hash_dedup = CONCAT('TRANSFER_', bt.id)
+   LEFT JOIN bank_accounts ba_dest ON ba_dest.id = COALESCE(bt.conta_destino_id, bt_mirror.account_id)
+   LEFT JOIN plano_contas_contas pc_ba_dest ON pc_ba_dest.id = ba_dest.plano_contas_conta_id
+   LEFT JOIN bank_accounts ba_orig ON ba_orig.id = bt.conta_origem_id
+   LEFT JOIN plano_contas_contas pc_ba_orig ON pc_ba_orig.id = ba_orig.plano_contas_conta_id
+   """
+
+
+def _contabil_transacoes(where_sql, params):
+    """Transações conciliadas do filtro, em ordem de data."""
+    with _conexao_stream() as conn, \
+            contextlib.closing(_ler_em_lotes(
+                conn,
+                _SQL_CONTABIL_TRANSACOES.replace(
+                    '__BT_DIGITOS__', digitos('bank_transactions', 'bt', 'cnpj_cpf'))
+                + where_sql + ' ORDER BY bt.data_transacao ASC, bt.id ASC',
+                params)) as linhas:
+        for r in linhas:
+            r['_kind'] = 'bank'
+            yield r
+
+
+def _contabil_vendas_cartao(cartao_conta_map, cliente_id, data_ini, data_fim):
+    """Vendas de cartão do período agrupadas por (dia, empresa, bandeira), em
+    ordem de data. Só as bandeiras com contas configuradas."""
+    cs_where = ["lc.data BETWEEN %s AND %s", "lcc.bandeira_cartao_id IS NOT NULL"]
+    cs_params = [data_ini, data_fim]
+    if cliente_id:
+        cs_where.append("lc.cliente_id = %s")
+        cs_params.append(cliente_id)
+    sql = f"""SELECT lc.data AS data_venda,
+                     lc.cliente_id,
+                     COALESCE(c.nome_fantasia, c.razao_social) AS empresa_nome,
+                     lcc.bandeira_cartao_id AS bandeira_id,
+                     bc.nome AS bandeira_nome,
+                     bc.tipo AS tipo_cartao,
+                     SUM(lcc.valor) AS total_venda
+                FROM lancamentos_caixa_comprovacao lcc
+                JOIN lancamentos_caixa lc ON lc.id = lcc.lancamento_caixa_id
+                JOIN bandeiras_cartao bc ON bc.id = lcc.bandeira_cartao_id
+                JOIN clientes c ON c.id = lc.cliente_id
+               WHERE {' AND '.join(cs_where)}
+               GROUP BY lc.data, lc.cliente_id, lcc.bandeira_cartao_id
+               ORDER BY lc.data, lc.cliente_id, bc.tipo, bc.nome"""
+    try:
+        with _conexao_stream() as conn, \
+                contextlib.closing(_ler_em_lotes(conn, sql, cs_params)) as linhas:
+            for r in linhas:
+                contas = cartao_conta_map.get((r['bandeira_id'], r['cliente_id']))
                 if not contas:
                     continue  # skip rows without configured accounts
-                card_sale_rows.append({
+                yield {
+                    '_kind':         'card',
                     'data_venda':    r['data_venda'],
                     'empresa_nome':  r['empresa_nome'] or '',
                     'bandeira_nome': r['bandeira_nome'] or '',
@@ -3121,23 +3256,29 @@ def exportar_contabil():
                     'credito_nome':  contas['credito'][1],
                     'debito_cod':    contas['debito'][0],
                     'debito_nome':   contas['debito'][1],
-                })
-        except Exception:
-            logger.warning("exportar_contabil: falha ao carregar card_sale_rows", exc_info=True)
+                }
+    except Exception:
+        logger.warning("exportar_contabil: falha ao carregar card_sale_rows", exc_info=True)
 
-    # Compute card fee rows: for each bank receipt on a card form, fee = cycle_sales - receipt.
-    # Entry: D: conta_despesa  /  C: conta_debito
-    card_fee_rows = []
-    _has_despesa_cfg = any(v.get('despesa') and v['despesa'][0] for v in cartao_conta_map.values())
-    if data_ini and data_fim and cartao_conta_map and _has_despesa_cfg:
-        try:
+
+def _contabil_taxas_cartao(cartao_conta_map, cliente_id, data_ini, data_fim):
+    """Taxas de cartão, em ordem de data: para cada recebimento numa forma de
+    cartão, taxa = vendas do ciclo - recebido.
+    Lançamento: D: conta_despesa  /  C: conta_debito
+
+    Vínculos, feriados e o índice de vendas (agregados por dia/bandeira/
+    empresa) são lidos inteiros; os recebimentos vêm em streaming.
+    """
+    try:
+        with _conexao_stream() as conn:
+            cursor = conn.cursor(dictionary=True)
             # Load feriados for business-day calculation
-            _feriados_set = set()
+            feriados = set()
             try:
                 cursor.execute("SELECT data FROM conf_cartoes_feriados")
-                for _fr in cursor.fetchall():
-                    _fd = _fr['data']
-                    _feriados_set.add(_fd.isoformat() if hasattr(_fd, 'isoformat') else str(_fd))
+                for fr in cursor.fetchall():
+                    fd = fr['data']
+                    feriados.add(fd.isoformat() if hasattr(fd, 'isoformat') else str(fd))
             except Exception:
                 pass
 
@@ -3148,318 +3289,253 @@ def exportar_contabil():
                      FROM conf_cartoes_vinculos v
                      JOIN bandeiras_cartao bc ON bc.id = v.bandeira_cartao_id"""
             )
-            _forma_to_band = defaultdict(list)
-            for _vr in cursor.fetchall():
-                _forma_to_band[_vr['forma_recebimento_id']].append(
-                    (_vr['bandeira_cartao_id'], int(_vr['prazo']))
+            forma_to_band = defaultdict(list)
+            for vr in cursor.fetchall():
+                forma_to_band[vr['forma_recebimento_id']].append(
+                    (vr['bandeira_cartao_id'], int(vr['prazo']))
                 )
+            if not forma_to_band:
+                cursor.close()
+                return
+            forma_ids = list(forma_to_band.keys())
+            max_prazo = max(p for vals in forma_to_band.values() for _, p in vals)
+            lookback = max_prazo + 6  # buffer for weekends/holidays
 
-            if _forma_to_band:
-                _forma_ids = list(_forma_to_band.keys())
-                _max_prazo = max(p for vals in _forma_to_band.values() for _, p in vals)
-                _lookback = _max_prazo + 6  # buffer for weekends/holidays
+            # Fetch sales extended backwards for cycle lookback
+            if isinstance(data_ini, str):
+                try:
+                    di_obj = _dt.datetime.strptime(data_ini, '%Y-%m-%d').date()
+                except ValueError:
+                    di_obj = None
+            elif isinstance(data_ini, _dt.date):
+                di_obj = data_ini
+            else:
+                di_obj = None
+            if di_obj is None:
+                di_obj = _dt.date.today()
+            ext_ini = di_obj - _dt.timedelta(days=lookback)
+            sw = ["lc.data BETWEEN %s AND %s", "lcc.bandeira_cartao_id IS NOT NULL"]
+            sp = [ext_ini.isoformat(), data_fim]
+            if cliente_id:
+                sw.append("lc.cliente_id = %s")
+                sp.append(cliente_id)
+            cursor.execute(
+                f"""SELECT lc.data AS data_venda, lcc.bandeira_cartao_id AS bandeira_id,
+                           lc.cliente_id, SUM(lcc.valor) AS total_venda
+                      FROM lancamentos_caixa_comprovacao lcc
+                      JOIN lancamentos_caixa lc ON lc.id = lcc.lancamento_caixa_id
+                     WHERE {' AND '.join(sw)}
+                     GROUP BY lc.data, lcc.bandeira_cartao_id, lc.cliente_id""",
+                sp,
+            )
+            sales_idx = {}
+            for sr in cursor.fetchall():
+                sd = sr['data_venda']
+                sd_iso = sd.isoformat() if hasattr(sd, 'isoformat') else str(sd)
+                sales_idx[(int(sr['bandeira_id']), sd_iso, int(sr['cliente_id']))] = \
+                    float(sr['total_venda'] or 0)
+            cursor.close()
+            calendario = CalendarioUteis(feriados, ext_ini)
+
+            # Query card receipts (CREDIT on card forms)
+            rph = ','.join(['%s'] * len(forma_ids))
+            rw = [
+                "bt.tipo = 'CREDIT'",
+                f"bt.forma_recebimento_id IN ({rph})",
+                "bt.data_transacao BETWEEN %s AND %s",
+            ]
+            rp = list(forma_ids) + [data_ini, data_fim]
+            if cliente_id:
+                rw.append("ba.cliente_id = %s")
+                rp.append(cliente_id)
+            sql = f"""SELECT bt.data_transacao, bt.forma_recebimento_id,
+                             ba.cliente_id, SUM(bt.valor) AS total_recebimento,
+                             COALESCE(c.nome_fantasia, c.razao_social) AS empresa_nome
+                        FROM bank_transactions bt
+                        JOIN bank_accounts ba ON ba.id = bt.account_id
+                        JOIN clientes c ON c.id = ba.cliente_id
+                       WHERE {' AND '.join(rw)}
+                       GROUP BY bt.data_transacao, bt.forma_recebimento_id, ba.cliente_id
+                       ORDER BY bt.data_transacao"""
+            with contextlib.closing(_ler_em_lotes(conn, sql, rp)) as recebimentos:
+                for rec in recebimentos:
+                    yield from _contabil_taxas_do_recebimento(
+                        rec, forma_to_band, cartao_conta_map, sales_idx, calendario, lookback)
+    except Exception:
+        logger.warning("exportar_contabil: falha ao carregar card_fee_rows", exc_info=True)
 
-                # empresa filter for receipts
-                _cs_emp2 = empresa_id
-                if not _cs_emp2 and account_id:
-                    cursor.execute(
-                        "SELECT cliente_id FROM bank_accounts WHERE id = %s", (account_id,)
-                    )
-                    _ba_row = cursor.fetchone()
-                    if _ba_row:
-                        _cs_emp2 = _ba_row['cliente_id']
-
-                # Query card receipts (CREDIT on card forms)
-                _rph = ','.join(['%s'] * len(_forma_ids))
-                _rw = [
-                    "bt.tipo = 'CREDIT'",
-                    f"bt.forma_recebimento_id IN ({_rph})",
-                    "bt.data_transacao BETWEEN %s AND %s",
-                ]
-                _rp = list(_forma_ids) + [data_ini, data_fim]
-                if _cs_emp2:
-                    _rw.append("ba.cliente_id = %s")
-                    _rp.append(_cs_emp2)
-                cursor.execute(
-                    f"""SELECT bt.data_transacao, bt.forma_recebimento_id,
-                               ba.cliente_id, SUM(bt.valor) AS total_recebimento,
-                               COALESCE(c.nome_fantasia, c.razao_social) AS empresa_nome
-                          FROM bank_transactions bt
-                          JOIN bank_accounts ba ON ba.id = bt.account_id
-                          JOIN clientes c ON c.id = ba.cliente_id
-                         WHERE {' AND '.join(_rw)}
-                         GROUP BY bt.data_transacao, bt.forma_recebimento_id, ba.cliente_id
-                         ORDER BY bt.data_transacao""",
-                    _rp,
-                )
-                _receipts = cursor.fetchall()
 
-                if _receipts:
-                    # Fetch sales extended backwards for cycle lookback
-                    if isinstance(data_ini, str):
-                        try:
-                            _di_obj = _dt.datetime.strptime(data_ini, '%Y-%m-%d').date()
-                        except ValueError:
-                            _di_obj = None
-                    elif isinstance(data_ini, _dt.date):
-                        _di_obj = data_ini
-                    else:
-                        _di_obj = None
-                    if _di_obj is None:
-                        _di_obj = _dt.date.today()
-                    _ext_ini = (_di_obj - _dt.timedelta(days=_lookback)).isoformat()
-                    _sw = ["lc.data BETWEEN %s AND %s", "lcc.bandeira_cartao_id IS NOT NULL"]
-                    _sp = [_ext_ini, data_fim]
-                    if _cs_emp2:
-                        _sw.append("lc.cliente_id = %s")
-                        _sp.append(_cs_emp2)
-                    cursor.execute(
-                        f"""SELECT lc.data AS data_venda, lcc.bandeira_cartao_id AS bandeira_id,
-                                   lc.cliente_id, SUM(lcc.valor) AS total_venda
-                              FROM lancamentos_caixa_comprovacao lcc
-                              JOIN lancamentos_caixa lc ON lc.id = lcc.lancamento_caixa_id
-                             WHERE {' AND '.join(_sw)}
-                             GROUP BY lc.data, lcc.bandeira_cartao_id, lc.cliente_id""",
-                        _sp,
-                    )
-                    _sales_idx = {}
-                    for _sr in cursor.fetchall():
-                        _sd = _sr['data_venda']
-                        _sd_iso = _sd.isoformat() if hasattr(_sd, 'isoformat') else str(_sd)
-                        _sales_idx[(int(_sr['bandeira_id']), _sd_iso, int(_sr['cliente_id']))] = \
-                            float(_sr['total_venda'] or 0)
-
-                    def _nbd(d, n, fs):
-                        """n business days after d."""
-                        while n > 0:
-                            d += _dt.timedelta(days=1)
-                            if d.weekday() < 5 and d.isoformat() not in fs:
-                                n -= 1
-                        return d
-
-                    for _rec in _receipts:
-                        _rd = _rec['data_transacao']
-                        _rd_obj = (
-                            _dt.datetime.strptime(_rd, '%Y-%m-%d').date()
-                            if isinstance(_rd, str) else _rd
-                        )
-                        _cli_id = int(_rec['cliente_id'])
-                        _receipt_amt = float(_rec['total_recebimento'] or 0)
-
-                        for _band_id, _prazo in _forma_to_band.get(_rec['forma_recebimento_id'], []):
-                            _contas = cartao_conta_map.get((_band_id, _cli_id))
-                            if not _contas or not _contas.get('despesa') or not _contas['despesa'][0]:
-                                continue
-
-                            # Sum sales whose expected receipt date equals _rd_obj
-                            _cycle_venda = 0.0
-                            for _delta in range(_lookback + 1):
-                                _sd_obj = _rd_obj - _dt.timedelta(days=_delta)
-                                _exp_rd = _nbd(_sd_obj, _prazo, _feriados_set)
-                                if _exp_rd == _rd_obj:
-                                    _sd_iso = _sd_obj.isoformat()
-                                    _cycle_venda += _sales_idx.get((_band_id, _sd_iso, _cli_id), 0.0)
-
-                            _cycle_fee = round(_cycle_venda - _receipt_amt, 2)
-                            if _cycle_fee < 0.005:
-                                continue  # skip zero / negligible / negative fees
-
-                            card_fee_rows.append({
-                                'data_recebimento': _rd_obj,
-                                'empresa_nome':  _rec['empresa_nome'] or '',
-                                'bandeira_nome': _contas['bandeira_nome'],
-                                'tipo_cartao':   _contas['tipo_cartao'],
-                                'cycle_fee':     _cycle_fee,
-                                'debito_cod':    _contas['despesa'][0],
-                                'debito_nome':   _contas['despesa'][1],
-                                'credito_cod':   _contas['debito'][0],
-                                'credito_nome':  _contas['debito'][1],
-                            })
-        except Exception:
-            logger.warning("exportar_contabil: falha ao carregar card_fee_rows", exc_info=True)
+def _contabil_taxas_do_recebimento(rec, forma_to_band, cartao_conta_map, sales_idx,
+                                   calendario, lookback):
+    """Linhas de taxa de um recebimento (uma por bandeira vinculada à forma)."""
+    rd = rec['data_transacao']
+    rd_obj = _dt.datetime.strptime(rd, '%Y-%m-%d').date() if isinstance(rd, str) else rd
+    cli_id = int(rec['cliente_id'])
+    receipt_amt = float(rec['total_recebimento'] or 0)
 
+    for band_id, prazo in forma_to_band.get(rec['forma_recebimento_id'], []):
+        contas = cartao_conta_map.get((band_id, cli_id))
+        if not contas or not contas.get('despesa') or not contas['despesa'][0]:
+            continue
 
-    cursor.close()
-    conn.close()
+        # Sum sales whose expected receipt date equals rd_obj
+        cycle_venda = 0.0
+        for delta in range(lookback + 1):
+            sd_obj = rd_obj - _dt.timedelta(days=delta)
+            if calendario.somar(sd_obj, prazo) == rd_obj:
+                cycle_venda += sales_idx.get((band_id, sd_obj.isoformat(), cli_id), 0.0)
+
+        cycle_fee = round(cycle_venda - receipt_amt, 2)
+        if cycle_fee < 0.005:
+            continue  # skip zero / negligible / negative fees
+
+        yield {
+            '_kind':            'fee',
+            'data_recebimento': rd_obj,
+            'empresa_nome':  rec['empresa_nome'] or '',
+            'bandeira_nome': contas['bandeira_nome'],
+            'tipo_cartao':   contas['tipo_cartao'],
+            'cycle_fee':     cycle_fee,
+            'debito_cod':    contas['despesa'][0],
+            'debito_nome':   contas['despesa'][1],
+            'credito_cod':   contas['debito'][0],
+            'credito_nome':  contas['debito'][1],
+        }
 
-    def _export_sort_key(r):
-        """Sort key for unified bank+card row list – uses whichever date field exists."""
-        d = r.get('data_transacao') or r.get('data_venda') or r.get('data_recebimento')
-        return d if d else _dt.date.min
-
-    if not _OPENPYXL_AVAILABLE:
-        # Fallback: CSV if openpyxl not installed
-        out = io.StringIO()
-        w = csv.writer(out, delimiter=';')
-        w.writerow(['DATA', 'DESCRIÇÃO', 'VALOR',
-                    'Nº CONTA CRÉDITO', 'DESCRIÇÃO CONTA CRÉDITO',
-                    'Nº CONTA DÉBITO',  'DESCRIÇÃO CONTA DÉBITO'])
-
-        csv_rows_bank = [dict(r, _kind='bank') for r in rows]
-        csv_rows_card = [dict(r, _kind='card') for r in card_sale_rows]
-        csv_rows_fee  = [dict(r, _kind='fee')  for r in card_fee_rows]
-        all_csv_rows = sorted(csv_rows_bank + csv_rows_card + csv_rows_fee, key=_export_sort_key)
-        for r in all_csv_rows:
-            if r['_kind'] == 'card':
-                d = r['data_venda']
-                w.writerow([
-                    d.strftime('%d/%m/%Y') if d else '',
-                    f"VENDA CARTÃO {r['tipo_cartao']} – {r['bandeira_nome']} ({r['empresa_nome']})",
-                    str(r['total_venda']).replace('.', ','),
-                    r['credito_cod'],
-                    r['credito_nome'],
-                    r['debito_cod'],
-                    r['debito_nome'],
-                ])
-            elif r['_kind'] == 'fee':
-                d = r['data_recebimento']
-                w.writerow([
-                    d.strftime('%d/%m/%Y') if d else '',
-                    f"TAXA CARTÃO {r['tipo_cartao']} – {r['bandeira_nome']} ({r['empresa_nome']})",
-                    str(r['cycle_fee']).replace('.', ','),
-                    r['credito_cod'],
-                    r['credito_nome'],
-                    r['debito_cod'],
-                    r['debito_nome'],
-                ])
-            else:
-                debito_cod, debito_nome, credito_cod, credito_nome = \
-                    _resolver_contas_contabeis(r, despesa_conta_map, coligada_map, fornecedor_conta_map, cnpj_conta_map,
-                                               troco_pix_conta_map=troco_pix_conta_map)
-                valor = r['valor']
-                w.writerow([
-                    r['data_transacao'].strftime('%d/%m/%Y') if r['data_transacao'] else '',
-                    r['descricao'] or '',
-                    str(valor).replace('.', ',') if valor is not None else '',
-                    credito_cod,
-                    credito_nome,
-                    debito_cod,
-                    debito_nome,
-                ])
-        out.seek(0)
-        return Response(
-            '\ufeff' + out.getvalue(),
-            mimetype='text/csv',
-            headers={'Content-Disposition': 'attachment; filename="exportacao_contabil.csv"'},
-        )
 
-    # --- Excel via openpyxl ---
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = 'Exportação Contábil'
+def _contabil_registros(fontes, resolvedor):
+    """Intercala as fontes (cada uma já em ordem de data) e resolve as contas.
+
+    heapq.merge segura uma linha por fonte; empate de data sai na ordem das
+    fontes e, dentro delas, na ordem em que vieram -- o mesmo que o sort
+    estável da lista concatenada (transações, vendas, taxas).
+
+    Gera (kind, data, descrição, valor, crédito_cod, crédito_nome,
+    débito_cod, débito_nome, linha).
+    """
+    contas, despesa = resolvedor.contas, resolvedor.despesa
+    for r in heapq.merge(*fontes, key=_contabil_data):
+        kind = r['_kind']
+        if kind == 'card':
+            yield (kind, r['data_venda'],
+                   f"VENDA CARTÃO {r['tipo_cartao']} – {r['bandeira_nome']} ({r['empresa_nome']})",
+                   r['total_venda'], r['credito_cod'], r['credito_nome'],
+                   r['debito_cod'], r['debito_nome'], r)
+        elif kind == 'fee':
+            yield (kind, r['data_recebimento'],
+                   f"TAXA CARTÃO {r['tipo_cartao']} – {r['bandeira_nome']} ({r['empresa_nome']})",
+                   r['cycle_fee'], r['credito_cod'], r['credito_nome'],
+                   r['debito_cod'], r['debito_nome'], r)
+        else:
+            debito_cod, debito_nome, credito_cod, credito_nome = \
+                contas(r, despesa(r.get('despesa_categorias')))
+            yield (kind, r['data_transacao'], r['descricao'] or '', r['valor'],
+                   credito_cod, credito_nome, debito_cod, debito_nome, r)
+
+
+def _contabil_csv(registros):
+    """CSV (';', BOM para o Excel abrir UTF-8) em pedaços de bytes, à medida
+    que os registros chegam."""
+    buf = io.StringIO()
+    w = csv.writer(buf, delimiter=';')
+    buf.write('\ufeff')
+    w.writerow(_CONTABIL_CABECALHO)
+    for _kind, data, descr, valor, credito_cod, credito_nome, debito_cod, debito_nome, _r in registros:
+        w.writerow([
+            data.strftime('%d/%m/%Y') if data else '',
+            descr,
+            str(valor).replace('.', ',') if valor is not None else '',
+            credito_cod,
+            credito_nome,
+            debito_cod,
+            debito_nome,
+        ])
+        if buf.tell() >= _CONTABIL_CSV_PEDACO:
+            yield buf.getvalue().encode('utf-8')
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue().encode('utf-8')
+
+
+def _contabil_xlsx(registros, destino):
+    """Grava a planilha em `destino` (caminho ou arquivo binário) no modo
+    write-only do openpyxl: cada linha é serializada no append, e a memória
+    não cresce com o número de linhas."""
+    import openpyxl
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font, PatternFill, Alignment
+    from openpyxl.utils import get_column_letter
+
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(title='Exportação Contábil')
 
     header_fill = PatternFill(start_color='1D63A5', end_color='1D63A5', fill_type='solid')
     header_font = Font(color='FFFFFF', bold=True, size=10)
     header_align = Alignment(horizontal='center', vertical='center', wrap_text=True)
 
-    headers = ['DATA', 'DESCRIÇÃO', 'VALOR',
-               'Nº CONTA CRÉDITO', 'DESCRIÇÃO CONTA CRÉDITO',
-               'Nº CONTA DÉBITO',  'DESCRIÇÃO CONTA DÉBITO']
-    col_widths = [12, 55, 14, 18, 32, 18, 32]
-    for col_idx, (h, w) in enumerate(zip(headers, col_widths), start=1):
-        cell = ws.cell(row=1, column=col_idx, value=h)
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = header_align
-        ws.column_dimensions[cell.column_letter].width = w
-
+    # Larguras, altura, congelamento e filtro precisam vir antes da primeira linha.
+    for col_idx, w in enumerate(_CONTABIL_LARGURAS, start=1):
+        ws.column_dimensions[get_column_letter(col_idx)].width = w
     ws.row_dimensions[1].height = 20
 
     # Freeze header row and enable auto-filter so the user can sort/filter columns
     ws.freeze_panes = 'A2'
-    ws.auto_filter.ref = f'A1:{ws.cell(row=1, column=len(headers)).column_letter}1'
+    ws.auto_filter.ref = f'A1:{get_column_letter(len(_CONTABIL_CABECALHO))}1'
+
+    cabecalho = []
+    for h in _CONTABIL_CABECALHO:
+        cell = WriteOnlyCell(ws, value=h)
+        cell.fill = header_fill
+        cell.font = header_font
+        cell.alignment = header_align
+        cabecalho.append(cell)
+    ws.append(cabecalho)
 
     warn_fill  = PatternFill(start_color='FFFF00', end_color='FFFF00', fill_type='solid')
     card_fill  = PatternFill(start_color='E8F5E9', end_color='E8F5E9', fill_type='solid')
     fee_fill   = PatternFill(start_color='FFF3E0', end_color='FFF3E0', fill_type='solid')
     money_fmt  = '#,##0.00'
 
-    # Build unified sorted row list: bank transactions + card sale rows + card fee rows
-    all_export_rows = []
-    for r in rows:
-        r['_kind'] = 'bank'
-        all_export_rows.append(r)
-    for r in card_sale_rows:
-        r['_kind'] = 'card'
-        all_export_rows.append(r)
-    for r in card_fee_rows:
-        r['_kind'] = 'fee'
-        all_export_rows.append(r)
-    all_export_rows.sort(key=_export_sort_key)
-
-    # collect (conta_apelido, banco_nome, tipo_problema) for warning sheet
-    _warn_accounts = []
-    for row_idx, r in enumerate(all_export_rows, start=2):
-        if r['_kind'] == 'card':
-            d = r['data_venda']
-            data_str = d.strftime('%d/%m/%Y') if d else ''
-            descr = f"VENDA CARTÃO {r['tipo_cartao']} – {r['bandeira_nome']} ({r['empresa_nome']})"
-            credito_cod  = r['credito_cod']
-            credito_nome = r['credito_nome']
-            debito_cod   = r['debito_cod']
-            debito_nome  = r['debito_nome']
-            ws.cell(row=row_idx, column=1, value=data_str)
-            ws.cell(row=row_idx, column=2, value=descr)
-            val_cell = ws.cell(row=row_idx, column=3, value=r['total_venda'])
-            val_cell.number_format = money_fmt
-            ws.cell(row=row_idx, column=4, value=credito_cod)
-            ws.cell(row=row_idx, column=5, value=credito_nome)
-            ws.cell(row=row_idx, column=6, value=debito_cod)
-            ws.cell(row=row_idx, column=7, value=debito_nome)
-            for col in range(1, 8):
-                ws.cell(row=row_idx, column=col).fill = card_fill
-        elif r['_kind'] == 'fee':
-            d = r['data_recebimento']
-            data_str = d.strftime('%d/%m/%Y') if d else ''
-            descr = f"TAXA CARTÃO {r['tipo_cartao']} – {r['bandeira_nome']} ({r['empresa_nome']})"
-            ws.cell(row=row_idx, column=1, value=data_str)
-            ws.cell(row=row_idx, column=2, value=descr)
-            val_cell = ws.cell(row=row_idx, column=3, value=r['cycle_fee'])
-            val_cell.number_format = money_fmt
-            ws.cell(row=row_idx, column=4, value=r['credito_cod'])
-            ws.cell(row=row_idx, column=5, value=r['credito_nome'])
-            ws.cell(row=row_idx, column=6, value=r['debito_cod'])
-            ws.cell(row=row_idx, column=7, value=r['debito_nome'])
-            for col in range(1, 8):
-                ws.cell(row=row_idx, column=col).fill = fee_fill
-        else:
-            debito_cod, debito_nome, credito_cod, credito_nome = \
-                _resolver_contas_contabeis(r, despesa_conta_map, coligada_map, fornecedor_conta_map, cnpj_conta_map,
-                                           troco_pix_conta_map=troco_pix_conta_map)
-            valor = r['valor']
-            data_str = r['data_transacao'].strftime('%d/%m/%Y') if r['data_transacao'] else ''
-
-            ws.cell(row=row_idx, column=1, value=data_str)
-            ws.cell(row=row_idx, column=2, value=r['descricao'] or '')
-            val_cell = ws.cell(row=row_idx, column=3, value=float(valor) if valor is not None else 0)
-            val_cell.number_format = money_fmt
-            ws.cell(row=row_idx, column=4, value=credito_cod)
-            ws.cell(row=row_idx, column=5, value=credito_nome)
-            ws.cell(row=row_idx, column=6, value=debito_cod)
-            ws.cell(row=row_idx, column=7, value=debito_nome)
-
-            # Highlight rows with missing codes in yellow and collect warning info
+    # Uma linha de células estilizadas por tipo, reaproveitada a cada append:
+    # o write-only serializa a linha na hora, então trocar só o value basta e
+    # evita registrar o mesmo estilo milhões de vezes.
+    def _modelo(fill):
+        cells = [WriteOnlyCell(ws) for _ in _CONTABIL_CABECALHO]
+        for c in cells:
+            if fill is not None:
+                c.fill = fill
+        cells[2].number_format = money_fmt
+        return cells
+
+    modelos = {'card': _modelo(card_fill), 'fee': _modelo(fee_fill),
+               'warn': _modelo(warn_fill), 'bank': _modelo(None)}
+
+    # (conta_apelido, banco_nome) -> problema, na ordem em que apareceram
+    _warn_accounts = {}
+    for kind, data, descr, valor, credito_cod, credito_nome, debito_cod, debito_nome, r in registros:
+        if kind == 'bank':
+            valor = float(valor) if valor is not None else 0
             missing_credito = not credito_cod
             missing_debito  = not debito_cod
             if missing_credito or missing_debito:
-                for col in range(1, 8):
-                    ws.cell(row=row_idx, column=col).fill = warn_fill
+                # Highlight rows with missing codes in yellow and collect warning info
+                kind = 'warn'
                 tipo_conc = (r.get('tipo_conciliacao') or '').lower()
                 if 'transferen' in tipo_conc:
+                    origem = r.get('conta_apelido') or r.get('banco_nome') or ''
                     if missing_debito:
                         dest_banco = r.get('conta_destino_banco_nome') or ''
                         if dest_banco:
-                            _warn_accounts.append((
-                                r.get('conta_apelido') or r.get('banco_nome') or '',
-                                dest_banco,
-                                'Conta destino sem Conta Contábil configurada'
-                            ))
+                            _warn_accounts.setdefault(
+                                (origem, dest_banco), 'Conta destino sem Conta Contábil configurada')
                     if missing_credito:
-                        _warn_accounts.append((
-                            r.get('conta_apelido') or r.get('banco_nome') or '',
-                            '',
-                            'Conta bancária sem Conta Contábil configurada'
-                        ))
+                        _warn_accounts.setdefault(
+                            (origem, ''), 'Conta bancária sem Conta Contábil configurada')
+        linha = modelos[kind]
+        for cell, v in zip(linha, (data.strftime('%d/%m/%Y') if data else '', descr, valor,
+                                   credito_cod, credito_nome, debito_cod, debito_nome)):
+            cell.value = v
+        ws.append(linha)
 
     # Warning sheet — lists accounts needing configuration in Gerenciar Contas
     if _warn_accounts:
@@ -3468,29 +3544,104 @@ def exportar_contabil():
         warn_hdr_font = Font(color='FFFFFF', bold=True, size=10)
         warn_headers  = ['CONTA BANCÁRIA (ORIGEM)', 'CONTA BANCÁRIA (DESTINO)', 'PROBLEMA']
         warn_widths   = [35, 35, 55]
+        hdr = []
         for ci, (h, w) in enumerate(zip(warn_headers, warn_widths), start=1):
-            cell = ws_warn.cell(row=1, column=ci, value=h)
+            cell = WriteOnlyCell(ws_warn, value=h)
             cell.fill = warn_hdr_fill
             cell.font = warn_hdr_font
-            ws_warn.column_dimensions[cell.column_letter].width = w
-        seen_warn = set()
-        for item in _warn_accounts:
-            key = item[:2]
-            if key not in seen_warn:
-                seen_warn.add(key)
-                for ci, val in enumerate(item, start=1):
-                    ws_warn.cell(row=len(seen_warn) + 1, column=ci, value=val)
+            hdr.append(cell)
+            ws_warn.column_dimensions[get_column_letter(ci)].width = w
+        ws_warn.append(hdr)
+        for (origem, destino_banco), problema in _warn_accounts.items():
+            ws_warn.append([origem, destino_banco, problema])
         # instruction row
-        instr_row = len(seen_warn) + 3
-        instr_cell = ws_warn.cell(
-            row=instr_row, column=1,
+        ws_warn.append([])
+        instr_cell = WriteOnlyCell(
+            ws_warn,
             value='Para corrigir: acesse Banco → Gerenciar Contas → edite cada conta e selecione a Conta do Plano de Contas correspondente.'
         )
         instr_cell.font = Font(italic=True, color='666666')
+        ws_warn.append([instr_cell])
+
+    wb.save(destino)
+
+
+@bp.route('/exportar-contabil')
+@login_required
+def exportar_contabil():
+    """Exporta lançamentos bancários no formato contábil (Excel).
+
+    Colunas: DATA / DESCRIÇÃO / VALOR / Nº CONTA CRÉDITO / DESCRIÇÃO CONTA CRÉDITO /
+             Nº CONTA DÉBITO / DESCRIÇÃO CONTA DÉBITO
+
+    Regras de CONTA CRÉDITO / CONTA DÉBITO:
+    - DEBIT  (saída):  CONTA CRÉDITO = plano_contas da conta bancária
+                       CONTA DÉBITO  = conta coligada da empresa destino (débito)
+                                       ou conta contábil da categoria de despesa
+    - CREDIT (entrada): CONTA DÉBITO  = plano_contas da conta bancária
+                        CONTA CRÉDITO = conta coligada da empresa origem (crédito)
+                                        ou conta contábil da forma de recebimento
+    Per-company coligada config fetched from bank_account_coligadas table.
+
+    ?formato=csv devolve CSV em streaming (também o caso sem openpyxl); o
+    padrão é o Excel, gravado em modo write-only num arquivo temporário.
+    """
+    _ensure_bank_accounts_coligadas()
+    _ensure_bank_account_coligadas_table()
+    _ensure_bt_conta_origem_id()
+    _ensure_bt_conta_destino_id()
+
+    account_id = request.args.get('account_id', '')
+    empresa_id = request.args.get('empresa_id', '')
+    data_ini   = request.args.get('data_ini', '')
+    data_fim   = request.args.get('data_fim', '')
+    formato    = request.args.get('formato', '').lower()
 
-    buf = io.BytesIO()
-    wb.save(buf)
-    buf.seek(0)
+    where_parts = ['bt.status = %s',
+                   # Exclui as linhas espelho CREDIT criadas automaticamente em transferências;
+                   # a linha DEBIT já contém toda a informação contábil (débito+crédito).
+                   "NOT (bt.tipo = 'CREDIT' AND COALESCE(bt.tipo_conciliacao,'') = 'transferencia')"]
+    params      = ['conciliado']
+
+    if account_id:
+        where_parts.append('bt.account_id = %s')
+        params.append(account_id)
+    if empresa_id:
+        where_parts.append('ba.cliente_id = %s')
+        params.append(empresa_id)
+    if data_ini:
+        where_parts.append('bt.data_transacao >= %s')
+        params.append(data_ini)
+    if data_fim:
+        where_parts.append('bt.data_transacao <= %s')
+        params.append(data_fim)
+
+    where_sql = 'WHERE ' + ' AND '.join(where_parts)
+
+    com_cartoes = False
+    empresa_cartoes = empresa_id
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        resolvedor = contas_contabeis.resolvedor(cursor, _contabil_mapas)
+        mapas = resolvedor.mapas
+        com_cartoes = bool(data_ini and data_fim and mapas['cartao'])
+        # Vendas/taxas de cartão: empresa explícita ou a da conta escolhida
+        if com_cartoes and not empresa_cartoes and account_id:
+            cursor.execute("SELECT cliente_id FROM bank_accounts WHERE id = %s", (account_id,))
+            row_ba = cursor.fetchone()
+            if row_ba:
+                empresa_cartoes = row_ba['cliente_id']
+    finally:
+        cursor.close()
+        conn.close()
+
+    fontes = [_contabil_transacoes(where_sql, params)]
+    if com_cartoes:
+        fontes.append(_contabil_vendas_cartao(mapas['cartao'], empresa_cartoes, data_ini, data_fim))
+        if any(v.get('despesa') and v['despesa'][0] for v in mapas['cartao'].values()):
+            fontes.append(_contabil_taxas_cartao(mapas['cartao'], empresa_cartoes, data_ini, data_fim))
+    registros = _contabil_registros(fontes, resolvedor)
 
     periodo = ''
     if data_ini and data_fim:
@@ -3499,12 +3650,26 @@ def exportar_contabil():
         periodo = f'_a_partir_{data_ini}'.replace('/', '-')
     elif data_fim:
         periodo = f'_ate_{data_fim}'.replace('/', '-')
-    filename = f'exportacao_contabil{periodo}.xlsx'
 
-    return Response(
-        buf.getvalue(),
+    if formato == 'csv' or not _OPENPYXL_AVAILABLE:
+        return Response(
+            stream_with_context(_contabil_csv(registros)),
+            mimetype='text/csv',
+            headers={'Content-Disposition': f'attachment; filename="exportacao_contabil{periodo}.csv"'},
+        )
+
+    arquivo = tempfile.TemporaryFile()
+    try:
+        _contabil_xlsx(registros, arquivo)
+        arquivo.seek(0)
+    except BaseException:
+        arquivo.close()
+        raise
+    return send_file(
+        arquivo,
         mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-        headers={'Content-Disposition': f'attachment; filename="{filename}"'},
+        as_attachment=True,
+        download_name=f'exportacao_contabil{periodo}.xlsx',
     )
 
 
@@ -3520,8 +3685,9 @@ def _resolver_contas_contabeis(row, despesa_conta_map, coligada_map=None,
     Para transferências, lookup é feito usando o cliente da conta destino/origem.
     fornecedor_conta_map: {(fornecedor_id, cliente_id): (codigo, nome)}
     Usado como fallback para débitos sem lançamento de despesa vinculado.
-    cnpj_conta_map: {(cnpj, cliente_id): (codigo, nome)}
-    Usado como fallback adicional quando fornecedor_id não está disponível mas o CNPJ está.
+    cnpj_conta_map: {(cnpj_digitos, cliente_id): (codigo, nome)}
+    Usado como fallback adicional quando fornecedor_id não está disponível mas o CNPJ está
+    (comparado só pelos dígitos: row['cnpj_cpf_digitos']).
     troco_pix_conta_map: {cliente_id: (codigo, nome)}
     Conta de débito configurada para lançamentos de Troco PIX por empresa.
     """
@@ -3603,7 +3769,7 @@ def _resolver_contas_contabeis(row, despesa_conta_map, coligada_map=None,
                         debito_cod, debito_nome = fmap[0] or '', fmap[1] or ''
                 # Fallback 2: use supplier's conta_contabil by CNPJ
                 if not debito_cod:
-                    cnpj = row.get('cnpj_cpf') or ''
+                    cnpj = row.get('cnpj_cpf_digitos') or ''
                     if cnpj and banco_cliente_id:
                         cmap = cnpj_conta_map.get((cnpj, banco_cliente_id))
                         if cmap:
@@ -3680,7 +3846,8 @@ def api_auto_reconcile():
     try:
         conn = get_db_connection()
         cursor = conn.cursor(dictionary=True)
-        # 1. Auto-conciliação por regras de descrição (regras têm prioridade sobre CNPJ)
+        # 1. Auto-conciliação por regras de descrição (regras têm prioridade sobre CNPJ).
+        #    Modo completo (sem tx_ids): reavalia todo o histórico pendente.
         por_regras = _auto_conciliar_por_regras(cursor, conn)
         logger.info("api_auto_reconcile: por_regras=%d", por_regras)
 
@@ -3809,35 +3976,25 @@ def api_diagnostico_regras():
                 'forn_id': r.get('fornecedor_id'),
             })
 
+        # Mesmo índice da auto-conciliação: o diagnóstico mostra exatamente o
+        # que `_auto_conciliar_por_regras` faria.
+        indice = indice_regras_para(regras)
         for tx in pendentes:
-            descricao = (tx.get('descricao') or '').upper()
             tipo = tx.get('tipo') or ''
-            for regra in regras:
-                regra_account_id = regra.get('account_id')
-                if regra_account_id and int(regra_account_id) != int(tx['account_id']):
-                    continue
-                tipo_regra = regra.get('tipo_transacao', 'AMBOS')
-                if tipo_regra != 'AMBOS' and tipo_regra != tipo:
-                    continue
-                padrao = (regra.get('padrao_descricao') or '').upper()
-                tipo_match = regra.get('tipo_match', 'contem')
-                match = (descricao == padrao) if tipo_match == 'exato' else (padrao in descricao)
-                if not match:
-                    continue
-                padrao2 = (regra.get('padrao_secundario') or '').upper()
-                if padrao2 and padrao2 not in descricao:
-                    continue
-                resultado['matches'].append({
-                    'tx_id': tx['id'],
-                    'tx_descricao': tx.get('descricao'),
-                    'tx_tipo': tipo,
-                    'tx_valor': str(tx.get('valor')),
-                    'regra_id': regra['id'],
-                    'regra_padrao': regra.get('padrao_descricao'),
-                    'titulo_id': regra.get('titulo_id'),
-                    'categoria_id': regra.get('categoria_id'),
-                })
-                break
+            pos = indice.primeira(tx.get('descricao'), tipo, tx['account_id'])
+            if pos is None:
+                continue
+            regra = regras[pos]
+            resultado['matches'].append({
+                'tx_id': tx['id'],
+                'tx_descricao': tx.get('descricao'),
+                'tx_tipo': tipo,
+                'tx_valor': str(tx.get('valor')),
+                'regra_id': regra['id'],
+                'regra_padrao': regra.get('padrao_descricao'),
+                'titulo_id': regra.get('titulo_id'),
+                'categoria_id': regra.get('categoria_id'),
+            })
 
         cursor.close()
         conn.close()
@@ -4189,6 +4346,7 @@ def api_salvar_coligadas(conta_id):
                            conta_credito_id = VALUES(conta_credito_id)""",
                     (conta_id, coligada_id, debito_id, credito_id),
                 )
+        contas_contabeis.invalidar(cursor)
         conn.commit()
     except Exception as e:
         conn.rollback()
@@ -4350,47 +4508,54 @@ def scan_inbox():
     # Arquivos OFX v1.x (SGML) geralmente usam codificação Latin-1 / ISO-8859-1.
     # Usar 'latin-1' com errors='replace' é a opção mais segura e universal:
     # todos os 256 valores de byte têm mapeamento, portanto nenhum byte causa erro.
+    # O arquivo é lido em streaming (iter_transactions decodifica os bytes
+    # incrementalmente) e fica aberto até o fim da gravação em lotes.
+    from integrations.ofx_parser import iter_transactions
     try:
-        with open(filepath, 'r', encoding='latin-1', errors='replace') as fh:
-            content = fh.read()
+        fh = open(filepath, 'rb')
     except OSError as exc:
         if request.is_json:
             return jsonify({'success': False, 'message': str(exc)}), 500
         flash(f'Erro ao ler arquivo: {exc}', 'danger')
         return redirect(url_for('bank_import.index'))
 
-    from integrations.ofx_parser import OFXParser
-    transactions = OFXParser(content).get_transactions()
+    with fh:
+        transactions = iter_transactions(fh)
+        primeira = next(transactions, None)
+        if primeira is None:
+            inseridos = None
+        else:
+            conn = get_db_connection()
+            cursor = conn.cursor(dictionary=True)
 
-    if not transactions:
-        if request.is_json:
-            return jsonify({'success': False, 'message': 'Nenhuma transação encontrada no arquivo OFX.'}), 422
-        flash('Nenhuma transação encontrada no arquivo OFX.', 'warning')
-        return redirect(url_for('bank_import.index'))
+            # ── Validação de data do arquivo ──────────────────────────────────
+            _ensure_bank_accounts_ultima_data()
+            data_arquivo, erro_data = _validar_data_importacao(nome_arquivo, account_id, cursor)
+            if erro_data:
+                cursor.close()
+                conn.close()
+                if request.is_json:
+                    return jsonify({'success': False, 'message': erro_data}), 422
+                flash(erro_data, 'danger')
+                return redirect(url_for('bank_import.index'))
+            # ─────────────────────────────────────────────────────────────────
+
+            _ensure_descricao_chave()
+            inseridos, duplicados, duplicados_lista = _save_transactions_em_lotes(
+                cursor, conn, account_id, itertools.chain([primeira], transactions)
+            )
 
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
+            # Atualiza a data do último extrato importado para esta conta
+            _atualizar_ultima_data_importacao(cursor, conn, account_id, data_arquivo)
 
-    # ── Validação de data do arquivo ──────────────────────────────────────────
-    _ensure_bank_accounts_ultima_data()
-    data_arquivo, erro_data = _validar_data_importacao(nome_arquivo, account_id, cursor)
-    if erro_data:
-        cursor.close()
-        conn.close()
+            cursor.close()
+            conn.close()
+
+    if inseridos is None:
         if request.is_json:
-            return jsonify({'success': False, 'message': erro_data}), 422
-        flash(erro_data, 'danger')
+            return jsonify({'success': False, 'message': 'Nenhuma transação encontrada no arquivo OFX.'}), 422
+        flash('Nenhuma transação encontrada no arquivo OFX.', 'warning')
         return redirect(url_for('bank_import.index'))
-    # ─────────────────────────────────────────────────────────────────────────
-
-    _ensure_descricao_chave()
-    inseridos, duplicados, duplicados_lista = _save_transactions(cursor, conn, account_id, transactions)
-
-    # Atualiza a data do último extrato importado para esta conta
-    _atualizar_ultima_data_importacao(cursor, conn, account_id, data_arquivo)
-
-    cursor.close()
-    conn.close()
 
     # Move o arquivo para o diretório de processados (OFX_PROCESSED_DIR)
     dest = os.path.join(processed, nome_arquivo)
@@ -4794,26 +4959,27 @@ def importar_dropbox():
             return redirect(url_for('bank_import.index'))
         # ─────────────────────────────────────────────────────────────────────
 
-        from integrations.dropbox_ofx import baixar_arquivo, mover_para_processados
+        from integrations.dropbox_ofx import baixar_arquivo_stream, mover_para_processados
+        from integrations.ofx_parser import iter_transactions
         try:
-            content = baixar_arquivo(nome_arquivo)
+            transactions = iter_transactions(baixar_arquivo_stream(nome_arquivo))
+            primeira = next(transactions, None)
         except RuntimeError as exc:
             if request.is_json:
                 return jsonify({'success': False, 'message': str(exc)}), 400
             flash(f'Erro ao baixar arquivo do Dropbox: {exc}', 'danger')
             return redirect(url_for('bank_import.index'))
 
-        from integrations.ofx_parser import OFXParser
-        transactions = OFXParser(content).get_transactions()
-
-        if not transactions:
+        if primeira is None:
             if request.is_json:
                 return jsonify({'success': False, 'message': 'Nenhuma transação encontrada no arquivo OFX.'}), 422
             flash('Nenhuma transação encontrada no arquivo OFX.', 'warning')
             return redirect(url_for('bank_import.index'))
 
         _ensure_descricao_chave()
-        inseridos, duplicados, duplicados_lista = _save_transactions(cursor, conn, account_id, transactions)
+        inseridos, duplicados, duplicados_lista = _save_transactions_em_lotes(
+            cursor, conn, account_id, itertools.chain([primeira], transactions)
+        )
 
         # Atualiza a data do último extrato importado para esta conta
         _atualizar_ultima_data_importacao(cursor, conn, account_id, data_arquivo)
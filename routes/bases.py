@@ -1,8 +1,11 @@
 from flask import Blueprint, render_template, current_app, url_for, jsonify, request, redirect, flash
 from flask_login import login_required, current_user
 from utils.db import get_db_connection
+from utils import dashboard_metricas
 from utils.pagamentos import classificar_recebimento
 from utils.fuso import hoje_brasilia, janelas_dia_mes
+from utils.periodo_sql import intervalo_mes
+from utils.schema_registry import schema_verificado
 
 bp = Blueprint('bases', __name__)
 
@@ -21,11 +24,12 @@ _ONDA1_CASE = (
 _ONDA1_ORDEM = ['Diesel S-500', 'Diesel S-10', 'Etanol', 'Gasolina C', 'ARLA']
 
 
-def _dados_onda1_dashboard(hoje=None):
+def _dados_onda1_dashboard(hoje=None, seguro=True):
     """Onda 1 do carrossel: Vendas do Dia, Vendas do Mês e Ranking do Dia.
 
     ISOLADO (conexão própria) e SOMENTE LEITURA. Nunca altera nada nem derruba
-    o dashboard: qualquer erro -> retorna estrutura vazia segura.
+    o dashboard: qualquer erro -> retorna estrutura vazia segura. Com
+    seguro=False o erro sobe (uso do dashboard_metricas: falha não é gravada).
 
     `hoje` é SEMPRE a data de Brasília (ver utils.fuso): dh_emissao está em
     horário de Brasília, então as janelas do dia e do mês são montadas nesse
@@ -198,6 +202,8 @@ def _dados_onda1_dashboard(hoje=None):
                 'recebimento': recebimento, 'recebimento_total': total_receb,
                 'repasse': repasse_card}
     except Exception:
+        if not seguro:
+            raise
         current_app.logger.exception('[dashboard onda1] falha ao coletar dados')
         return vazio
     finally:
@@ -221,7 +227,7 @@ def _calcular_lucro_fifo_dashboard(conn, ano, mes):
     """
     import calendar as _cal
     from datetime import date as _date
-    from collections import defaultdict as _dd
+    from utils.fifo import FilaFifo, avancar as avancar_fifo, calcular as calcular_fifo
 
     data_inicio = _date(ano, mes, 1)
     data_fim = _date(ano, mes, _cal.monthrange(ano, mes)[1])
@@ -235,8 +241,8 @@ def _calcular_lucro_fifo_dashboard(conn, ano, mes):
     try:
         cur.execute(
             "SELECT DISTINCT cliente_id FROM vendas_posto "
-            "WHERE YEAR(data_movimento)=%s AND MONTH(data_movimento)=%s",
-            (ano, mes)
+            "WHERE data_movimento >= %s AND data_movimento < %s",
+            intervalo_mes(ano, mes)
         )
         cliente_ids = [r['cliente_id'] for r in cur.fetchall()]
         if not cliente_ids:
@@ -293,8 +299,8 @@ def _calcular_lucro_fifo_dashboard(conn, ano, mes):
 
                         # Quando o mês anterior não está fechado, é necessário avançar
                         # as camadas de fifo_abertura até o início do mês corrente,
-                        # processando todas as transações intermediárias (mirrors
-                        # _advance_layers_to_date em relatorios.py).
+                        # processando todas as transações intermediárias (mesmo
+                        # avanço de _advance_layers_to_date em relatorios.py).
                         if not comp_ant:
                             ab_date = ab.get('data_abertura')
                             if ab_date:
@@ -313,11 +319,7 @@ def _calcular_lucro_fifo_dashboard(conn, ano, mes):
                                           AND COALESCE(f.quantidade_manual, q.valor, 0) > 0
                                         ORDER BY f.data_frete
                                     """, (cliente_id, pid, ab_date, data_inicio))
-                                    _pre_comp_by_date = _dd(list)
-                                    for row in cur.fetchall():
-                                        _pre_comp_by_date[row['data']].append(
-                                            {'qtde': float(row['qtde']), 'custo': float(row['custo'])}
-                                        )
+                                    _pre_compras = cur.fetchall()
                                     cur.execute("""
                                         SELECT data_movimento AS data,
                                                SUM(COALESCE(quantidade_litros, 0)) AS qtde
@@ -331,24 +333,9 @@ def _calcular_lucro_fifo_dashboard(conn, ano, mes):
                                         row['data']: float(row['qtde'] or 0)
                                         for row in cur.fetchall()
                                     }
-                                    _pre_dates = sorted(
-                                        set(list(_pre_comp_by_date.keys()) + list(_pre_vend_by_date.keys()))
-                                    )
-                                    for _d in _pre_dates:
-                                        for _c in _pre_comp_by_date.get(_d, []):
-                                            if _c['qtde'] > 0 and _c['custo'] > 0:
-                                                layers.append({'qtde': _c['qtde'], 'custo': _c['custo']})
-                                        _qv = _pre_vend_by_date.get(_d, 0.0)
-                                        if _qv > 0:
-                                            _restante = _qv
-                                            while _restante > 0.001 and layers:
-                                                _lay = layers[0]
-                                                if _lay['qtde'] <= _restante + 0.001:
-                                                    _restante -= _lay['qtde']
-                                                    layers.pop(0)
-                                                else:
-                                                    _lay['qtde'] -= _restante
-                                                    _restante = 0.0
+                                    _fila = FilaFifo(layers)
+                                    avancar_fifo(_fila, _pre_compras, _pre_vend_by_date)
+                                    layers = _fila.camadas()
 
                 # Compras = fretes entregues neste client para este produto no mês
                 cur.execute("""
@@ -381,43 +368,10 @@ def _calcular_lucro_fifo_dashboard(conn, ano, mes):
                     continue
 
                 # Calcular FIFO
-                comp_by_date = _dd(list)
-                for c in compras:
-                    comp_by_date[c['data']].append(c)
-                vend_by_date = _dd(list)
-                for v in vendas:
-                    vend_by_date[v['data']].append(v)
-
-                all_dates = sorted(set(list(comp_by_date.keys()) + list(vend_by_date.keys())))
-                qtde_saida = 0.0
-                receita = 0.0
-                cogs = 0.0
-
-                for data in all_dates:
-                    for comp in comp_by_date.get(data, []):
-                        qtde = float(comp['qtde'])
-                        custo = float(comp['custo'])
-                        if qtde > 0:
-                            layers.append({'qtde': qtde, 'custo': custo})
-
-                    for vend in vend_by_date.get(data, []):
-                        qtde_vender = float(vend['qtde'])
-                        valor = float(vend['valor_total'])
-                        if qtde_vender <= 0:
-                            continue
-                        qtde_saida += qtde_vender
-                        receita += valor
-                        restante = qtde_vender
-                        while restante > 0.001 and layers:
-                            layer = layers[0]
-                            if layer['qtde'] <= restante + 0.001:
-                                cogs += layer['qtde'] * layer['custo']
-                                restante -= layer['qtde']
-                                layers.pop(0)
-                            else:
-                                cogs += restante * layer['custo']
-                                layer['qtde'] -= restante
-                                restante = 0.0
+                res_fifo, _ = calcular_fifo(layers, compras, vendas, exato=False)
+                qtde_saida = res_fifo['qtde_saida']
+                receita = res_fifo['receita_saida']
+                cogs = res_fifo['cogs']
 
                 lucro = receita - cogs
                 if pnome not in prod_resultado:
@@ -436,6 +390,276 @@ def _calcular_lucro_fifo_dashboard(conn, ano, mes):
         cur.close()
 
 
+# ── Blocos de KPI da home, materializados em dashboard_metricas ──────────────
+# Cada função calcula UM bloco (dict pronto para o template) a partir de uma
+# conexão; utils.dashboard_metricas decide quando recalcular e guarda o JSON.
+# Erro numa consulta derruba só o bloco (a home cai nos zeros padrão e o valor
+# não é gravado) — por isso aqui não há try/except por consulta.
+
+def _meses_grafico(hoje):
+    """Rótulos 'MM/AAAA' dos últimos 6 meses e o 1º dia do mais antigo."""
+    from datetime import date
+    labels = []
+    ini_6m = None   # 1º dia do mês mais antigo do gráfico (substitui CURDATE())
+    for i in range(5, -1, -1):
+        mes_offset = hoje.month - i
+        ano_offset = hoje.year
+        while mes_offset <= 0:
+            mes_offset += 12
+            ano_offset -= 1
+        labels.append(f"{mes_offset:02d}/{ano_offset}")
+        if ini_6m is None:
+            ini_6m = date(ano_offset, mes_offset, 1).strftime('%Y-%m-%d')
+    return labels, ini_6m
+
+
+def _escalar(cursor, sql, params=(), tipo=int):
+    cursor.execute(sql, params)
+    return tipo(cursor.fetchone()[0] or 0)
+
+
+def _bloco_cadastros(conn, hoje):
+    cursor = conn.cursor()
+    try:
+        return {
+            'total_clientes': _escalar(cursor, "SELECT COUNT(1) FROM clientes"),
+            'total_fornecedores': _escalar(cursor, "SELECT COUNT(1) FROM fornecedores"),
+            'total_motoristas': _escalar(cursor, "SELECT COUNT(1) FROM motoristas"),
+            'total_fretes': _escalar(cursor, "SELECT COUNT(1) FROM fretes"),
+            'total_pedidos': _escalar(cursor, "SELECT COUNT(1) FROM pedidos"),
+        }
+    finally:
+        cursor.close()
+
+
+def _bloco_fretes(conn, hoje):
+    cursor = conn.cursor()
+    ym = intervalo_mes(hoje.year, hoje.month)
+    try:
+        dados = {
+            'fretes_mes': _escalar(
+                cursor, "SELECT COUNT(1) FROM fretes WHERE data_frete >= %s AND data_frete < %s", ym),
+            # Volume transportado do mês atual (soma quantidade fretes)
+            'volume_transportado_mes': _escalar(
+                cursor,
+                """SELECT COALESCE(SUM(COALESCE(f.quantidade_manual, q.valor)), 0)
+                   FROM fretes f
+                   LEFT JOIN quantidades q ON f.quantidade_id = q.id
+                   WHERE f.data_frete >= %s AND f.data_frete < %s""", ym, float),
+            # Receita do mês atual (valor_total_frete)
+            'receita_mes': _escalar(
+                cursor,
+                """SELECT COALESCE(SUM(valor_total_frete), 0) FROM fretes
+                   WHERE data_frete >= %s AND data_frete < %s""", ym, float),
+            'lucro_fretes_mes': _escalar(
+                cursor,
+                """SELECT COALESCE(SUM(lucro), 0) FROM fretes
+                   WHERE data_frete >= %s AND data_frete < %s""", ym, float),
+        }
+
+        # Volume transportado por produto do mês atual
+        cursor.execute(
+            """SELECT COALESCE(pr.nome, 'Não especificado'),
+                      COALESCE(SUM(COALESCE(f.quantidade_manual, q.valor)), 0) AS vol
+               FROM fretes f
+               LEFT JOIN quantidades q ON f.quantidade_id = q.id
+               LEFT JOIN produto pr ON f.produto_id = pr.id
+               WHERE f.data_frete >= %s AND f.data_frete < %s
+               GROUP BY pr.id, pr.nome
+               ORDER BY vol DESC""",
+            ym
+        )
+        dados['volume_transportado_por_produto'] = [
+            {'nome': row[0], 'valor': float(row[1] or 0)}
+            for row in cursor.fetchall()
+        ]
+
+        # Fretes por empresa do mês atual (top 5 + DEMAIS EMPRESAS)
+        cursor.execute(
+            """SELECT COALESCE(cl.razao_social, 'Não especificado') AS empresa,
+                      COALESCE(SUM(COALESCE(f.quantidade_manual, q.valor, 0)), 0) AS qtd_frete,
+                      COALESCE(SUM(f.valor_total_frete), 0) AS valor_frete
+               FROM fretes f
+               LEFT JOIN quantidades q ON f.quantidade_id = q.id
+               LEFT JOIN clientes cl ON f.clientes_id = cl.id
+               WHERE f.data_frete >= %s AND f.data_frete < %s
+               GROUP BY f.clientes_id, cl.razao_social
+               ORDER BY qtd_frete DESC""",
+            ym
+        )
+        all_emp = [
+            {'empresa': row[0], 'qtd_frete': float(row[1] or 0), 'valor_frete': float(row[2] or 0)}
+            for row in cursor.fetchall()
+        ]
+        top5 = all_emp[:5]
+        demais = all_emp[5:]
+        if demais:
+            top5.append({
+                'empresa': 'DEMAIS EMPRESAS',
+                'qtd_frete': sum(e['qtd_frete'] for e in demais),
+                'valor_frete': sum(e['valor_frete'] for e in demais),
+            })
+        dados['fretes_por_empresa'] = top5
+        dados['fretes_por_empresa_total_qtd'] = sum(e['qtd_frete'] for e in all_emp)
+        dados['fretes_por_empresa_total_valor'] = sum(e['valor_frete'] for e in all_emp)
+        return dados
+    finally:
+        cursor.close()
+
+
+def _bloco_pedidos(conn, hoje):
+    cursor = conn.cursor()
+    try:
+        return {'pedidos_mes': _escalar(
+            cursor,
+            "SELECT COUNT(1) FROM pedidos WHERE data_pedido >= %s AND data_pedido < %s",
+            intervalo_mes(hoje.year, hoje.month))}
+    finally:
+        cursor.close()
+
+
+def _bloco_grafico(conn, hoje):
+    """Fretes, pedidos e volume transportado por mês (últimos 6 meses)."""
+    labels, ini_6m = _meses_grafico(hoje)
+    series = {'fretes': [0] * 6, 'pedidos': [0] * 6, 'volume': [0] * 6}
+    consultas = (
+        ('fretes', int,
+         """SELECT MONTH(data_frete) AS mes, YEAR(data_frete) AS ano, COUNT(1) AS total
+            FROM fretes
+            WHERE data_frete >= %s
+            GROUP BY ano, mes
+            ORDER BY ano, mes"""),
+        ('pedidos', int,
+         """SELECT MONTH(data_pedido) AS mes, YEAR(data_pedido) AS ano, COUNT(1) AS total
+            FROM pedidos
+            WHERE data_pedido >= %s
+            GROUP BY ano, mes
+            ORDER BY ano, mes"""),
+        ('volume', float,
+         """SELECT MONTH(f.data_frete) AS mes, YEAR(f.data_frete) AS ano,
+                   COALESCE(SUM(COALESCE(f.quantidade_manual, q.valor)), 0) AS total
+            FROM fretes f
+            LEFT JOIN quantidades q ON f.quantidade_id = q.id
+            WHERE f.data_frete >= %s
+            GROUP BY ano, mes
+            ORDER BY ano, mes"""),
+    )
+    cursor = conn.cursor()
+    try:
+        for serie, tipo, sql in consultas:
+            cursor.execute(sql, (ini_6m,))
+            for row in cursor.fetchall():
+                mes_ano = f"{int(row[0]):02d}/{int(row[1])}"
+                if mes_ano in labels:
+                    series[serie][labels.index(mes_ano)] = tipo(row[2])
+    finally:
+        cursor.close()
+    return dict(series, labels=labels)
+
+
+def _bloco_vendas_posto(conn, hoje):
+    """Volume vendido do mês atual (vendas_posto – litros vendidos nos postos)."""
+    cursor = conn.cursor()
+    ym = intervalo_mes(hoje.year, hoje.month)
+    try:
+        volume = _escalar(
+            cursor,
+            """SELECT COALESCE(SUM(vp.quantidade_litros), 0)
+               FROM vendas_posto vp
+               WHERE vp.data_movimento >= %s AND vp.data_movimento < %s""", ym, float)
+        cursor.execute(
+            """SELECT COALESCE(pr.nome, 'Não especificado'),
+                      COALESCE(SUM(vp.quantidade_litros), 0) AS vol
+               FROM vendas_posto vp
+               LEFT JOIN produto pr ON vp.produto_id = pr.id
+               WHERE vp.data_movimento >= %s AND vp.data_movimento < %s
+               GROUP BY vp.produto_id, pr.nome
+               ORDER BY vol DESC""",
+            ym
+        )
+        return {
+            'volume_vendido_mes': volume,
+            'volume_vendido_por_produto': [
+                {'nome': row[0], 'valor': float(row[1] or 0)}
+                for row in cursor.fetchall()
+            ],
+        }
+    finally:
+        cursor.close()
+
+
+def _bloco_lucro_postos(conn, hoje):
+    """Lucro por produto do mês atual (fifo_resumo_mensal – postos FIFO)."""
+    dados = {'lucro_por_produto': [], 'lucro_postos_mes': 0.0,
+             'lucro_postos_disponivel': False, 'lucro_postos_fechado': False}
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """SELECT COALESCE(pr.nome, 'Não especificado'),
+                      COALESCE(SUM(rm.lucro_bruto), 0) AS lucro,
+                      COALESCE(SUM(rm.qtde_saida), 0) AS qtde
+               FROM fifo_resumo_mensal rm
+               JOIN fifo_competencia fc ON rm.competencia_id = fc.id
+               LEFT JOIN produto pr ON rm.produto_id = pr.id
+               WHERE fc.ano_mes = %s
+                 AND rm.substituido = 0
+               GROUP BY rm.produto_id, pr.nome
+               ORDER BY lucro DESC""",
+            (hoje.strftime('%Y-%m'),)
+        )
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+    if rows:
+        dados['lucro_postos_disponivel'] = True
+        dados['lucro_postos_fechado'] = True
+        dados['lucro_por_produto'] = [
+            {'nome': row[0], 'valor': float(row[1] or 0), 'qtde': float(row[2] or 0)}
+            for row in rows
+        ]
+        dados['lucro_postos_mes'] = sum(p['valor'] for p in dados['lucro_por_produto'])
+    else:
+        # Mês não fechado – calcular on-the-fly via FIFO. Falha aqui sobe:
+        # dashboard_metricas.obter mantém o valor anterior e não grava zeros.
+        lucro_por_produto, lucro_postos_mes = _calcular_lucro_fifo_dashboard(
+            conn, hoje.year, hoje.month
+        )
+        dados['lucro_por_produto'] = lucro_por_produto
+        dados['lucro_postos_mes'] = lucro_postos_mes
+        dados['lucro_postos_disponivel'] = bool(lucro_por_produto)
+    return dados
+
+
+def _calculos_dashboard(conn, hoje):
+    """{bloco: fn() -> dict} no formato de utils.dashboard_metricas.obter."""
+    return {
+        'cadastros': lambda: _bloco_cadastros(conn, hoje),
+        'fretes': lambda: _bloco_fretes(conn, hoje),
+        'pedidos': lambda: _bloco_pedidos(conn, hoje),
+        'grafico': lambda: _bloco_grafico(conn, hoje),
+        'vendas_posto': lambda: _bloco_vendas_posto(conn, hoje),
+        'lucro_postos': lambda: _bloco_lucro_postos(conn, hoje),
+        # Onda 1 abre a própria conexão (isolada).
+        'onda1': lambda: _dados_onda1_dashboard(hoje, seguro=False),
+    }
+
+
+def metricas_dashboard(hoje=None, forcar=False):
+    """
+    Blocos de KPI da home para o mês de `hoje` (Brasília): lê
+    dashboard_metricas e recalcula só o que estiver ausente/sujo/vencido.
+    Usado pela home e pelo agendador. Retorna (dados_por_bloco, recalculados).
+    """
+    if hoje is None:
+        hoje = hoje_brasilia()
+    conn = get_db_connection()
+    try:
+        return dashboard_metricas.obter(
+            conn, hoje.strftime('%Y-%m'), _calculos_dashboard(conn, hoje), forcar=forcar)
+    finally:
+        conn.close()
+
+
 def safe_url(endpoint, **values):
     """
     Retorna url_for(endpoint, **values) se o endpoint existir no app,
@@ -462,7 +686,23 @@ def index():
             return redirect(url_for('lancamentos_caixa.lista'))
     
     import calendar
-    from datetime import datetime, date
+    from datetime import date
+
+    # Data de referência de TODOS os blocos abaixo (KPIs do mês, detalhamento
+    # por produto, gráfico de 6 meses, mes_atual). Tem que ser a data de
+    # BRASÍLIA, não date.today() (= data UTC no servidor): dia 31 às 21h BRT já
+    # é dia 1 em UTC, e o dashboard inteiro pulava para o mês seguinte.
+    # Mesma função da Onda 1 (utils.fuso) — nada de segunda lógica de fuso.
+    hoje = hoje_brasilia()
+
+    # Blocos de KPI: uma leitura de dashboard_metricas; só o bloco ausente,
+    # sujo ou vencido é recalculado aqui (normalmente o agendador já fez isso).
+    try:
+        blocos, _ = metricas_dashboard(hoje)
+    except Exception:
+        # se não conseguiu conectar, deixamos os totais em zero
+        current_app.logger.warning('[home] métricas do dashboard indisponíveis', exc_info=True)
+        blocos = {}
 
     # coletar métricas simples do banco (fallback para 0 em caso de erro)
     totals = {
@@ -478,333 +718,40 @@ def index():
         'receita_mes': 0.0,
         'lucro_fretes_mes': 0.0,
     }
-    volume_transportado_por_produto = []
-    volume_vendido_por_produto = []
-    fretes_por_empresa = []
-    fretes_por_empresa_total_qtd = 0.0
-    fretes_por_empresa_total_valor = 0.0
-    lucro_por_produto = []
-    lucro_postos_mes = 0.0
-    lucro_postos_disponivel = False
-    lucro_postos_fechado = False
-
-    # Data de referência de TODOS os blocos abaixo (KPIs do mês, detalhamento
-    # por produto, gráfico de 6 meses, mes_atual). Tem que ser a data de
-    # BRASÍLIA, não date.today() (= data UTC no servidor): dia 31 às 21h BRT já
-    # é dia 1 em UTC, e o dashboard inteiro pulava para o mês seguinte.
-    # Mesma função da Onda 1 (utils.fuso) — nada de segunda lógica de fuso.
-    hoje = hoje_brasilia()
-    meses_labels = []
-    fretes_por_mes = []
-    pedidos_por_mes = []
-    volume_por_mes = []
-    ini_6m = None   # 1º dia do mês mais antigo do gráfico (substitui CURDATE())
-    for i in range(5, -1, -1):
-        # calcular mês/ano
-        mes_offset = hoje.month - i
-        ano_offset = hoje.year
-        while mes_offset <= 0:
-            mes_offset += 12
-            ano_offset -= 1
-        meses_labels.append(f"{mes_offset:02d}/{ano_offset}")
-        if ini_6m is None:
-            ini_6m = date(ano_offset, mes_offset, 1).strftime('%Y-%m-%d')
-        fretes_por_mes.append(0)
-        pedidos_por_mes.append(0)
-        volume_por_mes.append(0)
-
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        try:
-            cursor.execute("SELECT COUNT(1) FROM clientes")
-            totals['total_clientes'] = int(cursor.fetchone()[0] or 0)
-        except Exception:
-            totals['total_clientes'] = 0
-
-        try:
-            cursor.execute("SELECT COUNT(1) FROM fornecedores")
-            totals['total_fornecedores'] = int(cursor.fetchone()[0] or 0)
-        except Exception:
-            totals['total_fornecedores'] = 0
-
-        try:
-            cursor.execute("SELECT COUNT(1) FROM motoristas")
-            totals['total_motoristas'] = int(cursor.fetchone()[0] or 0)
-        except Exception:
-            totals['total_motoristas'] = 0
-
-        try:
-            cursor.execute("SELECT COUNT(1) FROM fretes")
-            totals['total_fretes'] = int(cursor.fetchone()[0] or 0)
-        except Exception:
-            totals['total_fretes'] = 0
-
-        try:
-            cursor.execute("SELECT COUNT(1) FROM pedidos")
-            totals['total_pedidos'] = int(cursor.fetchone()[0] or 0)
-        except Exception:
-            totals['total_pedidos'] = 0
-
-        # Fretes do mês atual
-        try:
-            cursor.execute(
-                "SELECT COUNT(1) FROM fretes WHERE YEAR(data_frete)=%s AND MONTH(data_frete)=%s",
-                (hoje.year, hoje.month)
-            )
-            totals['fretes_mes'] = int(cursor.fetchone()[0] or 0)
-        except Exception:
-            totals['fretes_mes'] = 0
-
-        # Pedidos do mês atual
-        try:
-            cursor.execute(
-                "SELECT COUNT(1) FROM pedidos WHERE YEAR(data_pedido)=%s AND MONTH(data_pedido)=%s",
-                (hoje.year, hoje.month)
-            )
-            totals['pedidos_mes'] = int(cursor.fetchone()[0] or 0)
-        except Exception:
-            totals['pedidos_mes'] = 0
-
-        # Fretes por mês (últimos 6 meses)
-        try:
-            cursor.execute(
-                """SELECT MONTH(data_frete) AS mes, YEAR(data_frete) AS ano, COUNT(1) AS total
-                   FROM fretes
-                   WHERE data_frete >= %s
-                   GROUP BY ano, mes
-                   ORDER BY ano, mes""",
-                (ini_6m,)
-            )
-            rows = cursor.fetchall()
-            for row in rows:
-                mes_ano = f"{int(row[0]):02d}/{int(row[1])}"
-                if mes_ano in meses_labels:
-                    idx = meses_labels.index(mes_ano)
-                    fretes_por_mes[idx] = int(row[2])
-        except Exception:
-            pass
-
-        # Pedidos por mês (últimos 6 meses)
-        try:
-            cursor.execute(
-                """SELECT MONTH(data_pedido) AS mes, YEAR(data_pedido) AS ano, COUNT(1) AS total
-                   FROM pedidos
-                   WHERE data_pedido >= %s
-                   GROUP BY ano, mes
-                   ORDER BY ano, mes""",
-                (ini_6m,)
-            )
-            rows = cursor.fetchall()
-            for row in rows:
-                mes_ano = f"{int(row[0]):02d}/{int(row[1])}"
-                if mes_ano in meses_labels:
-                    idx = meses_labels.index(mes_ano)
-                    pedidos_por_mes[idx] = int(row[2])
-        except Exception:
-            pass
-
-        # Volume transportado do mês atual (soma quantidade fretes)
-        try:
-            cursor.execute(
-                """SELECT COALESCE(SUM(COALESCE(f.quantidade_manual, q.valor)), 0)
-                   FROM fretes f
-                   LEFT JOIN quantidades q ON f.quantidade_id = q.id
-                   WHERE YEAR(f.data_frete)=%s AND MONTH(f.data_frete)=%s""",
-                (hoje.year, hoje.month)
-            )
-            totals['volume_transportado_mes'] = float(cursor.fetchone()[0] or 0)
-        except Exception:
-            totals['volume_transportado_mes'] = 0.0
-
-        # Volume vendido do mês atual (vendas_posto – litros vendidos nos postos)
-        try:
-            cursor.execute(
-                """SELECT COALESCE(SUM(vp.quantidade_litros), 0)
-                   FROM vendas_posto vp
-                   WHERE YEAR(vp.data_movimento)=%s AND MONTH(vp.data_movimento)=%s""",
-                (hoje.year, hoje.month)
-            )
-            totals['volume_vendido_mes'] = float(cursor.fetchone()[0] or 0)
-        except Exception:
-            totals['volume_vendido_mes'] = 0.0
-
-        # Receita do mês atual (valor_total_frete)
-        try:
-            cursor.execute(
-                """SELECT COALESCE(SUM(valor_total_frete), 0) FROM fretes
-                   WHERE YEAR(data_frete)=%s AND MONTH(data_frete)=%s""",
-                (hoje.year, hoje.month)
-            )
-            totals['receita_mes'] = float(cursor.fetchone()[0] or 0)
-        except Exception:
-            totals['receita_mes'] = 0.0
-
-        # Lucro fretes do mês atual
-        try:
-            cursor.execute(
-                """SELECT COALESCE(SUM(lucro), 0) FROM fretes
-                   WHERE YEAR(data_frete)=%s AND MONTH(data_frete)=%s""",
-                (hoje.year, hoje.month)
-            )
-            totals['lucro_fretes_mes'] = float(cursor.fetchone()[0] or 0)
-        except Exception:
-            totals['lucro_fretes_mes'] = 0.0
-
-        # Volume transportado por mês (últimos 6 meses)
-        try:
-            cursor.execute(
-                """SELECT MONTH(f.data_frete) AS mes, YEAR(f.data_frete) AS ano,
-                          COALESCE(SUM(COALESCE(f.quantidade_manual, q.valor)), 0) AS total
-                   FROM fretes f
-                   LEFT JOIN quantidades q ON f.quantidade_id = q.id
-                   WHERE f.data_frete >= %s
-                   GROUP BY ano, mes
-                   ORDER BY ano, mes""",
-                (ini_6m,)
-            )
-            rows = cursor.fetchall()
-            for row in rows:
-                mes_ano = f"{int(row[0]):02d}/{int(row[1])}"
-                if mes_ano in meses_labels:
-                    idx = meses_labels.index(mes_ano)
-                    volume_por_mes[idx] = float(row[2])
-        except Exception:
-            pass
-
-        # Volume transportado por produto do mês atual
-        volume_transportado_por_produto = []
-        try:
-            cursor.execute(
-                """SELECT COALESCE(pr.nome, 'Não especificado'),
-                          COALESCE(SUM(COALESCE(f.quantidade_manual, q.valor)), 0) AS vol
-                   FROM fretes f
-                   LEFT JOIN quantidades q ON f.quantidade_id = q.id
-                   LEFT JOIN produto pr ON f.produto_id = pr.id
-                   WHERE YEAR(f.data_frete)=%s AND MONTH(f.data_frete)=%s
-                   GROUP BY pr.id, pr.nome
-                   ORDER BY vol DESC""",
-                (hoje.year, hoje.month)
-            )
-            volume_transportado_por_produto = [
-                {'nome': row[0], 'valor': float(row[1] or 0)}
-                for row in cursor.fetchall()
-            ]
-        except Exception:
-            pass
-
-        # Volume vendido por produto do mês atual (vendas_posto)
-        volume_vendido_por_produto = []
-        try:
-            cursor.execute(
-                """SELECT COALESCE(pr.nome, 'Não especificado'),
-                          COALESCE(SUM(vp.quantidade_litros), 0) AS vol
-                   FROM vendas_posto vp
-                   LEFT JOIN produto pr ON vp.produto_id = pr.id
-                   WHERE YEAR(vp.data_movimento)=%s AND MONTH(vp.data_movimento)=%s
-                   GROUP BY vp.produto_id, pr.nome
-                   ORDER BY vol DESC""",
-                (hoje.year, hoje.month)
-            )
-            volume_vendido_por_produto = [
-                {'nome': row[0], 'valor': float(row[1] or 0)}
-                for row in cursor.fetchall()
-            ]
-        except Exception:
-            pass
-
-        # Fretes por empresa do mês atual (top 5 + DEMAIS EMPRESAS)
-        fretes_por_empresa = []
-        fretes_por_empresa_total_qtd = 0.0
-        fretes_por_empresa_total_valor = 0.0
-        try:
-            cursor.execute(
-                """SELECT COALESCE(cl.razao_social, 'Não especificado') AS empresa,
-                          COALESCE(SUM(COALESCE(f.quantidade_manual, q.valor, 0)), 0) AS qtd_frete,
-                          COALESCE(SUM(f.valor_total_frete), 0) AS valor_frete
-                   FROM fretes f
-                   LEFT JOIN quantidades q ON f.quantidade_id = q.id
-                   LEFT JOIN clientes cl ON f.clientes_id = cl.id
-                   WHERE YEAR(f.data_frete)=%s AND MONTH(f.data_frete)=%s
-                   GROUP BY f.clientes_id, cl.razao_social
-                   ORDER BY qtd_frete DESC""",
-                (hoje.year, hoje.month)
-            )
-            all_emp = [
-                {'empresa': row[0], 'qtd_frete': float(row[1] or 0), 'valor_frete': float(row[2] or 0)}
-                for row in cursor.fetchall()
-            ]
-            top5 = all_emp[:5]
-            demais = all_emp[5:]
-            if demais:
-                top5.append({
-                    'empresa': 'DEMAIS EMPRESAS',
-                    'qtd_frete': sum(e['qtd_frete'] for e in demais),
-                    'valor_frete': sum(e['valor_frete'] for e in demais),
-                })
-            fretes_por_empresa = top5
-            fretes_por_empresa_total_qtd = sum(e['qtd_frete'] for e in all_emp)
-            fretes_por_empresa_total_valor = sum(e['valor_frete'] for e in all_emp)
-        except Exception:
-            pass
-
-        # Lucro por produto do mês atual (fifo_resumo_mensal – postos FIFO)
-        lucro_por_produto = []
-        lucro_postos_mes = 0.0
-        lucro_postos_disponivel = False
-        lucro_postos_fechado = False
-        try:
-            ano_mes = hoje.strftime('%Y-%m')
-            cursor.execute(
-                """SELECT COALESCE(pr.nome, 'Não especificado'),
-                          COALESCE(SUM(rm.lucro_bruto), 0) AS lucro,
-                          COALESCE(SUM(rm.qtde_saida), 0) AS qtde
-                   FROM fifo_resumo_mensal rm
-                   JOIN fifo_competencia fc ON rm.competencia_id = fc.id
-                   LEFT JOIN produto pr ON rm.produto_id = pr.id
-                   WHERE fc.ano_mes = %s
-                     AND rm.substituido = 0
-                   GROUP BY rm.produto_id, pr.nome
-                   ORDER BY lucro DESC""",
-                (ano_mes,)
-            )
-            rows = cursor.fetchall()
-            if rows:
-                lucro_postos_disponivel = True
-                lucro_postos_fechado = True
-                lucro_por_produto = [
-                    {'nome': row[0], 'valor': float(row[1] or 0), 'qtde': float(row[2] or 0)}
-                    for row in rows
-                ]
-                lucro_postos_mes = sum(p['valor'] for p in lucro_por_produto)
-            else:
-                # Mês não fechado – calcular on-the-fly via FIFO
-                try:
-                    lucro_por_produto, lucro_postos_mes = _calcular_lucro_fifo_dashboard(
-                        conn, hoje.year, hoje.month
-                    )
-                    if lucro_por_produto:
-                        lucro_postos_disponivel = True
-                except Exception:
-                    pass
-        except Exception:
-            pass
-
-    except Exception:
-        # se não conseguiu conectar, deixamos os totais em zero
-        pass
-    finally:
-        try:
-            cursor.close()
-            conn.close()
-        except Exception:
-            pass
+    listas = {
+        'volume_transportado_por_produto': [],
+        'volume_vendido_por_produto': [],
+        'fretes_por_empresa': [],
+        'fretes_por_empresa_total_qtd': 0.0,
+        'fretes_por_empresa_total_valor': 0.0,
+        'lucro_por_produto': [],
+        'lucro_postos_mes': 0.0,
+        'lucro_postos_disponivel': False,
+        'lucro_postos_fechado': False,
+    }
+    for bloco in ('cadastros', 'fretes', 'pedidos', 'vendas_posto', 'lucro_postos'):
+        for chave, valor in (blocos.get(bloco) or {}).items():
+            if chave in totals:
+                totals[chave] = valor
+            elif chave in listas:
+                listas[chave] = valor
+
+    meses_labels, _ini_6m = _meses_grafico(hoje)
+    grafico = blocos.get('grafico') or {
+        'fretes': [0] * 6, 'pedidos': [0] * 6, 'volume': [0] * 6,
+    }
+    grafico = {
+        'labels': meses_labels,
+        'fretes': grafico['fretes'],
+        'pedidos': grafico['pedidos'],
+        'volume': grafico['volume'],
+    }
 
     # Onda 1 do carrossel (isolado; conexão própria; nunca derruba o dashboard).
     # Data de Brasília explícita: `hoje` acima já é a mesma coisa, mas a Onda 1
     # não pode depender disso — se alguém mexer no `hoje` dos blocos antigos,
     # os cards do dia não podem voltar a zerar depois das 21h BRT.
-    onda1 = _dados_onda1_dashboard(hoje_brasilia())
+    onda1 = blocos.get('onda1') or _dados_onda1_dashboard(hoje_brasilia())
 
     # Construir URLs do relatório de lucro para o mês atual
     primeiro_dia = date(hoje.year, hoje.month, 1)
@@ -818,13 +765,6 @@ def index():
     )
     importar_pedido_url = "https://app.postonovohorizonte.com.br/pedidos/importar"
 
-    grafico = {
-        'labels': meses_labels,
-        'fretes': fretes_por_mes,
-        'pedidos': pedidos_por_mes,
-        'volume': volume_por_mes,
-    }
-
     # URLs seguras para o template (se endpoint inexistente, retorna '#')
     links = {
         'fretes_novo_url': safe_url('fretes.novo'),
@@ -850,15 +790,7 @@ def index():
     context.update(totals)
     context.update(links)
     context['grafico'] = grafico
-    context['volume_transportado_por_produto'] = volume_transportado_por_produto
-    context['volume_vendido_por_produto'] = volume_vendido_por_produto
-    context['fretes_por_empresa'] = fretes_por_empresa
-    context['fretes_por_empresa_total_qtd'] = fretes_por_empresa_total_qtd
-    context['fretes_por_empresa_total_valor'] = fretes_por_empresa_total_valor
-    context['lucro_por_produto'] = lucro_por_produto
-    context['lucro_postos_mes'] = lucro_postos_mes
-    context['lucro_postos_disponivel'] = lucro_postos_disponivel
-    context['lucro_postos_fechado'] = lucro_postos_fechado
+    context.update(listas)
     _meses_pt = ['Janeiro','Fevereiro','Março','Abril','Maio','Junho',
                  'Julho','Agosto','Setembro','Outubro','Novembro','Dezembro']
     context['mes_atual'] = f"{_meses_pt[hoje.month - 1]}/{hoje.year}"
@@ -1083,4 +1015,4 @@ def excluir(id):
 
 @bp.route('/health', methods=['GET'])
 def health():
-    return jsonify(status='ok')
+    return jsonify(status='ok', schema_verificado=schema_verificado())
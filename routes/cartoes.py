@@ -1,8 +1,10 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 from flask_login import login_required
+from utils import contas_contabeis
 from utils.db import get_db_connection
 from utils.decorators import admin_required, supervisor_or_admin_required
 from utils.text_utils import normalize_text_field
+from utils.schema_registry import garantia
 
 bp = Blueprint('cartoes', __name__, url_prefix='/cartoes')
 
@@ -11,6 +13,7 @@ VALID_TIPOS = {'DEBITO', 'CREDITO'}
 MAX_NOME_LENGTH = 50
 
 
+@garantia
 def _ensure_cabal_debito():
     """Insere a bandeira 'CABAL / OUTROS' (DÉBITO) se ainda não existir no banco."""
     conn = None
@@ -29,7 +32,7 @@ def _ensure_cabal_debito():
         )
         conn.commit()
     except Exception:
-        pass  # tabela ainda não existe ou registro já presente
+        return False  # tabela ainda não existe
     finally:
         if cur is not None:
             cur.close()
@@ -165,6 +168,8 @@ def editar(id):
                     ativo = %s
                 WHERE id = %s
             """, (nome, tipo, int(ativo), id))
+            # nome/tipo entram nas descrições do exportar_contabil
+            contas_contabeis.invalidar(cursor)
             conn.commit()
             flash('Cartão atualizado com sucesso!', 'success')
             return redirect(url_for('cartoes.lista'))
@@ -216,6 +221,7 @@ def bloquear(id):
             SET ativo = %s
             WHERE id = %s
         """, (novo_status, id))
+        contas_contabeis.invalidar(cursor)
         conn.commit()
         
         status_text = 'desbloqueado' if novo_status else 'bloqueado'
@@ -1,12 +1,16 @@
 """CRUD de regras de conciliação automática (bank_conciliacao_regras)."""
 
 import logging
+import queue
+import threading
 import pytz
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from flask_login import login_required, current_user
 from utils.db import get_db_connection
-from utils.conciliacao import reverter_varias
+from utils.conciliacao import reverter_uma, reverter_varias
 from utils.navegacao import destino_pos_acao
+from utils.regras_conciliacao import IndiceRegras
+from utils.schema_registry import garantia
 
 _BRASILIA = pytz.timezone('America/Sao_Paulo')
 
@@ -17,6 +21,7 @@ bp = Blueprint('conciliacao_regras', __name__, url_prefix='/banco/regras')
 _bsm_descricao_chave_ready = False
 
 
+@garantia
 def _ensure_descricao_chave():
     """Garante que bank_supplier_mapping.descricao_chave existe. Idempotente."""
     global _bsm_descricao_chave_ready
@@ -60,6 +65,7 @@ def _ensure_descricao_chave():
         _bsm_descricao_chave_ready = True
     except Exception:
         logger.warning("_ensure_descricao_chave (conciliacao_regras): falhou", exc_info=True)
+        return False
     finally:
         if conn:
             conn.close()
@@ -107,6 +113,215 @@ def _get_contas(cursor):
     return cursor.fetchall()
 
 
+# ---------------------------------------------------------------------------
+# Reavaliação em segundo plano
+# ---------------------------------------------------------------------------
+# Criar, editar ou reativar uma regra pode mudar o destino de transações que
+# já estão no banco. Em vez de rodar a auto-conciliação do histórico inteiro
+# (ou esperar o próximo upload), a regra entra numa fila e uma thread do
+# worker reavalia só as transações que ela PODE casar — o filtro SQL é um
+# superconjunto (LIKE é case/acento-insensível); quem decide é o mesmo
+# índice de regras da auto-conciliação, com todas as regras ativas na ordem
+# de prioridade.
+#
+# Editar ou desativar uma regra também vale para o que ela JÁ conciliou: as
+# transações 'auto-regra' que a versão antiga casava e vinculou ao destino
+# antigo são desfeitas (utils.conciliacao.reverter_uma) e voltam a passar pelas
+# regras ativas. Sem isso ficariam presas no destino de uma regra que mudou.
+
+_reavaliar_fila = queue.Queue()
+_reavaliar_pendentes = set()
+_reavaliar_refazer = {}     # regra_id -> ids conciliados pela versão antiga
+_reavaliar_lock = threading.Lock()
+_reavaliar_thread = None
+
+
+def _like(padrao):
+    """Padrão LIKE '%...%' com os curingas do texto escapados."""
+    esc = padrao.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return '%' + esc + '%'
+
+
+_SITUACAO_CANDIDATA = "(status='pendente' OR (status='conciliado' AND conciliado_por='auto'))"
+_SITUACAO_DA_REGRA = "status='conciliado' AND conciliado_por='auto-regra'"
+
+
+def _filtro_da_regra(regra, situacao=_SITUACAO_CANDIDATA):
+    """(where, params) que todo candidato de *regra* satisfaz, ou None.
+
+    Precisa ser superconjunto do que `IndiceRegras` casa: o padrão 'exato' vai
+    cru (o matcher compara sem strip), padrão 'contem' vazio casa com qualquer
+    descrição e não vira LIKE, e tipo_transacao NULL nunca casa.
+    """
+    tipo = regra.get('tipo_transacao', 'AMBOS')
+    if tipo is None:
+        return None
+    padrao_bruto = regra.get('padrao_descricao') or ''
+    padrao2 = (regra.get('padrao_secundario') or '').strip()
+
+    where = [situacao]
+    params = []
+    if regra.get('tipo_match', 'contem') == 'exato':
+        if padrao_bruto:
+            where.append("descricao = %s")
+            params.append(padrao_bruto)
+        else:
+            # descrição NULL vale '' para o matcher
+            where.append("(descricao = '' OR descricao IS NULL)")
+    elif padrao_bruto.strip():
+        where.append("descricao LIKE %s")
+        params.append(_like(padrao_bruto.strip()))
+    if padrao2:
+        where.append("descricao LIKE %s")
+        params.append(_like(padrao2))
+    if tipo != 'AMBOS':
+        where.append("tipo = %s")
+        params.append(tipo)
+    if regra.get('account_id'):
+        where.append("account_id = %s")
+        params.append(regra['account_id'])
+    return where, params
+
+
+def _ids_que_a_regra_pode_casar(cursor, regra):
+    """Transações pendentes/auto que passam no filtro da regra (superconjunto)."""
+    filtro = _filtro_da_regra(regra)
+    if filtro is None:
+        return []
+    where, params = filtro
+
+    cursor.execute(
+        "SELECT id FROM bank_transactions WHERE " + " AND ".join(where),
+        params,
+    )
+    return [r['id'] for r in cursor.fetchall()]
+
+
+def _ids_conciliados_pela_regra(cursor, regra):
+    """Transações que *regra* (como está agora, antes de editar/desativar)
+    auto-conciliou: 'auto-regra', casadas por ela e com o destino dela.
+
+    A transação não guarda o id da regra; o destino é o que a auto-conciliação
+    gravou — a despesa lançada (regra de despesa em DEBIT) ou forma/fornecedor.
+    """
+    filtro = _filtro_da_regra(regra, _SITUACAO_DA_REGRA)
+    if filtro is None:
+        return []
+    where, params = filtro
+
+    simples = "forma_recebimento_id <=> %s AND fornecedor_id <=> %s"
+    destino = [regra.get('forma_recebimento_id'), regra.get('fornecedor_id')]
+    if regra.get('titulo_id') and regra.get('categoria_id'):
+        where.append(
+            "((tipo = 'DEBIT' AND EXISTS (SELECT 1 FROM lancamentos_despesas ld"
+            " WHERE ld.bank_transaction_id = bank_transactions.id"
+            " AND ld.titulo_id = %s AND ld.categoria_id = %s))"
+            " OR (tipo <> 'DEBIT' AND " + simples + "))"
+        )
+        params = params + [regra['titulo_id'], regra['categoria_id']] + destino
+    else:
+        where.append(simples)
+        params = params + destino
+
+    cursor.execute(
+        "SELECT id, descricao, tipo, account_id FROM bank_transactions WHERE "
+        + " AND ".join(where),
+        params,
+    )
+    indice = IndiceRegras([regra])
+    return [
+        r['id'] for r in cursor.fetchall()
+        if indice.primeira(r['descricao'], r['tipo'] or '', r['account_id']) is not None
+    ]
+
+
+def _desfazer_conciliadas(conn, tx_ids):
+    """Devolve para 'pendente' as de *tx_ids* que ainda estão 'auto-regra'
+    (quem foi conciliado à mão nesse meio tempo fica como está)."""
+    ph = ','.join(['%s'] * len(tx_ids))
+    cur_w = conn.cursor()
+    try:
+        cur_w.execute(
+            f"SELECT id FROM bank_transactions WHERE id IN ({ph})"
+            f" AND {_SITUACAO_DA_REGRA} FOR UPDATE",
+            list(tx_ids),
+        )
+        ids = [r[0] for r in cur_w.fetchall()]
+        for tx_id in ids:
+            reverter_uma(cur_w, tx_id, logger)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur_w.close()
+    return ids
+
+
+def _reavaliar_regra(regra_id, refazer=()):
+    """Reaplica as regras ativas às transações que *regra_id* pode casar e
+    às de *refazer* (conciliadas pela versão antiga da regra)."""
+    from routes.bank_import import _auto_conciliar_por_regras
+
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        ids = set(_desfazer_conciliadas(conn, sorted(refazer))) if refazer else set()
+        cursor.execute(
+            "SELECT * FROM bank_conciliacao_regras WHERE id=%s AND ativo=1",
+            (regra_id,),
+        )
+        regra = cursor.fetchone()
+        if regra:
+            ids.update(_ids_que_a_regra_pode_casar(cursor, regra))
+        if not ids:
+            return 0
+        aplicadas = _auto_conciliar_por_regras(cursor, conn, tx_ids=sorted(ids))
+        logger.info(
+            "reavaliacao da regra %s: %d candidata(s), %d conciliada(s)",
+            regra_id, len(ids), aplicadas,
+        )
+        return aplicadas
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def _worker_reavaliacao():
+    while True:
+        regra_id = _reavaliar_fila.get()
+        with _reavaliar_lock:
+            _reavaliar_pendentes.discard(regra_id)
+            refazer = _reavaliar_refazer.pop(regra_id, ())
+        try:
+            _reavaliar_regra(regra_id, refazer)
+        except Exception:
+            logger.warning("reavaliacao da regra %s falhou", regra_id, exc_info=True)
+        finally:
+            _reavaliar_fila.task_done()
+
+
+def agendar_reavaliacao(regra_id, refazer=()):
+    """Coloca *regra_id* na fila de reavaliação (sem duplicar) e volta na hora.
+
+    *refazer*: transações que a versão antiga da regra conciliou; são desfeitas
+    antes da reavaliação. Somam-se às de um agendamento ainda pendente.
+    """
+    global _reavaliar_thread
+    with _reavaliar_lock:
+        if refazer:
+            _reavaliar_refazer.setdefault(regra_id, set()).update(refazer)
+        if regra_id in _reavaliar_pendentes:
+            return
+        _reavaliar_pendentes.add(regra_id)
+        if _reavaliar_thread is None or not _reavaliar_thread.is_alive():
+            _reavaliar_thread = threading.Thread(
+                target=_worker_reavaliacao, name="regras-reavaliacao", daemon=True,
+            )
+            _reavaliar_thread.start()
+    _reavaliar_fila.put(regra_id)
+
+
 @bp.route('/')
 @login_required
 def lista():
@@ -268,7 +483,9 @@ def novo():
                  forma_id, fornecedor_id, cliente_id, titulo_id,
                  categoria_id, subcategoria_id, account_id),
             )
+            nova_id = cursor.lastrowid
             conn.commit()
+            agendar_reavaliacao(nova_id)
             flash('Regra criada com sucesso!', 'success')
             cursor.close()
             conn.close()
@@ -318,6 +535,7 @@ def editar(regra_id):
         if not padrao:
             flash('Padrão de descrição é obrigatório.', 'warning')
         else:
+            refazer = _ids_conciliados_pela_regra(cursor, regra) if regra.get('ativo') else []
             cursor.execute(
                 """UPDATE bank_conciliacao_regras
                    SET padrao_descricao=%s, padrao_secundario=%s, tipo_match=%s,
@@ -330,6 +548,8 @@ def editar(regra_id):
                  categoria_id, subcategoria_id, account_id, regra_id),
             )
             conn.commit()
+            if regra.get('ativo'):
+                agendar_reavaliacao(regra_id, refazer)
             flash('Regra atualizada!', 'success')
             cursor.close()
             conn.close()
@@ -354,13 +574,16 @@ def toggle(regra_id):
     """Ativa ou desativa uma regra."""
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT ativo FROM bank_conciliacao_regras WHERE id=%s", (regra_id,))
+    cursor.execute("SELECT * FROM bank_conciliacao_regras WHERE id=%s", (regra_id,))
     r = cursor.fetchone()
     if r:
         novo_status = 0 if r['ativo'] else 1
+        refazer = [] if novo_status else _ids_conciliados_pela_regra(cursor, r)
         cursor.execute("UPDATE bank_conciliacao_regras SET ativo=%s WHERE id=%s",
                        (novo_status, regra_id))
         conn.commit()
+        if novo_status or refazer:
+            agendar_reavaliacao(regra_id, refazer)
         flash('Regra ' + ('ativada' if novo_status else 'desativada') + '.', 'info')
     cursor.close()
     conn.close()
@@ -373,12 +596,15 @@ def excluir(regra_id):
     """Exclui uma regra; se já aplicada, apenas desativa."""
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT total_aplicacoes FROM bank_conciliacao_regras WHERE id=%s", (regra_id,))
+    cursor.execute("SELECT * FROM bank_conciliacao_regras WHERE id=%s", (regra_id,))
     r = cursor.fetchone()
     if r:
         if r['total_aplicacoes'] > 0:
+            refazer = _ids_conciliados_pela_regra(cursor, r) if r['ativo'] else []
             cursor.execute("UPDATE bank_conciliacao_regras SET ativo=0 WHERE id=%s", (regra_id,))
             conn.commit()
+            if refazer:
+                agendar_reavaliacao(regra_id, refazer)
             flash(f'Regra já foi aplicada {r["total_aplicacoes"]} vez(es) — foi desativada.', 'info')
         else:
             cursor.execute("DELETE FROM bank_conciliacao_regras WHERE id=%s", (regra_id,))
@@ -405,13 +631,17 @@ def excluir_lote():
     # ids validated as integers above; f-string only builds %s placeholders, values stay parameterized
     ph = ','.join(['%s'] * len(ids))
     cursor.execute(
-        f"SELECT id, total_aplicacoes FROM bank_conciliacao_regras WHERE id IN ({ph})",
+        f"SELECT * FROM bank_conciliacao_regras WHERE id IN ({ph})",
         ids,
     )
     rows = cursor.fetchall()
 
     excluir_ids  = [r['id'] for r in rows if r['total_aplicacoes'] == 0]
     desativar_ids = [r['id'] for r in rows if r['total_aplicacoes'] > 0]
+    refazer = {
+        r['id']: _ids_conciliados_pela_regra(cursor, r)
+        for r in rows if r['total_aplicacoes'] > 0 and r['ativo']
+    }
 
     if excluir_ids:
         ph2 = ','.join(['%s'] * len(excluir_ids))
@@ -426,6 +656,9 @@ def excluir_lote():
     conn.commit()
     cursor.close()
     conn.close()
+    for rid, tx_ids in refazer.items():
+        if tx_ids:
+            agendar_reavaliacao(rid, tx_ids)
 
     partes = []
     if excluir_ids:
@@ -25,7 +25,10 @@ from flask import Blueprint, render_template, request, jsonify
 from flask_login import login_required
 
 from routes.auth import admin_required
+from utils import contas_contabeis
 from utils.db import get_db_connection
+from utils.dias_uteis import CalendarioUteis
+from utils.schema_registry import garantia
 
 import logging
 _logger = logging.getLogger(__name__)
@@ -51,7 +54,9 @@ def _parse_iso(d):
 
 
 def _next_business_day(d, n, feriados_set):
-    """Retorna a data que é exatamente n dias úteis após d (pula fins de semana e feriados)."""
+    """Retorna a data que é exatamente n dias úteis após d (pula fins de semana e feriados).
+
+    Dia a dia; o relatório usa utils.dias_uteis.CalendarioUteis (mesmo resultado)."""
     count = 0
     while count < n:
         d = d + timedelta(days=1)
@@ -81,6 +86,7 @@ def _default_period():
     return hoje.replace(day=1).isoformat(), hoje.isoformat()
 
 
+@garantia
 def _ensure_vinculos_table(conn):
     """Cria a tabela de vinculações se ainda não existir e migra a chave única."""
     cur = conn.cursor()
@@ -158,6 +164,7 @@ def _ensure_vinculos_table(conn):
     cur.close()
 
 
+@garantia
 def _ensure_conta_contabil_table(conn):
     """Cria a tabela de configuração contábil de cartões se não existir."""
     cur = conn.cursor()
@@ -250,6 +257,7 @@ def _get_config_contabil(conn):
     return {(r['bandeira_cartao_id'], r['cliente_id']): r for r in rows}
 
 
+@garantia
 def _ensure_feriados_table(conn):
     """Cria a tabela de feriados municipais/estaduais se não existir."""
     cur = conn.cursor()
@@ -456,6 +464,18 @@ def _fmt_date(d):
     return str(d)
 
 
+class _Memo(dict):
+    """Cache de uma função de um argumento, por relatório."""
+
+    def __init__(self, fn):
+        super().__init__()
+        self.fn = fn
+
+    def __missing__(self, chave):
+        valor = self[chave] = self.fn(chave)
+        return valor
+
+
 def _build_report(bandeiras, vinculos_map, vendas_rows, recebimentos_rows, feriados_set=None, data_inicio_obj=None):
     """
     Para cada bandeira vinculada, organiza as vendas em ciclos de liquidação
@@ -471,26 +491,38 @@ def _build_report(bandeiras, vinculos_map, vendas_rows, recebimentos_rows, feria
     DIF (taxa):  +  = operadora descontou taxa  (venda > recebimento)
                  −  = operadora pagou a mais    (recebimento > venda)
     %  = (vendas_ciclo − recebimento) / vendas_ciclo × 100
+
+    Vendas e recebimentos são agrupados por bandeira/forma numa passada só, e
+    a data esperada de cada venda sai de um calendário de dias úteis montado
+    uma vez (utils.dias_uteis) em vez de andar dia a dia por venda.
     """
     if feriados_set is None:
         feriados_set = set()
 
-    # Index vendas: (bandeira_id, data_iso) → total_venda
-    vendas_idx = {}
+    # strptime era o que mais pesava: cada data ISO é convertida/formatada uma
+    # vez por relatório, não uma vez por linha.
+    datas_obj = _Memo(_parse_iso)
+    datas_fmt = _Memo(_fmt_date)
+
+    # Vendas por bandeira: {bandeira_id: {data_iso: total_venda}}
+    vendas_band = defaultdict(dict)
     for r in vendas_rows:
         d = r['data_venda']
         if hasattr(d, 'isoformat'):
             d = d.isoformat()
-        vendas_idx[(int(r['bandeira_id']), str(d))] = float(r['total_venda'] or 0)
+        d = str(d)
+        vendas_band[int(r['bandeira_id'])][d] = float(r['total_venda'] or 0)
 
-    # Index recebimentos: (forma_id, data_iso) → total_recebimento
-    receb_idx = {}
+    # Recebimentos por forma: {forma_id: {data_iso: total_recebimento}}
+    receb_forma = defaultdict(dict)
     for r in recebimentos_rows:
         d = r['data_recebimento']
         if hasattr(d, 'isoformat'):
             d = d.isoformat()
-        key = (int(r['forma_id']), str(d))
-        receb_idx[key] = float(r['total_recebimento'] or 0)
+        receb_forma[int(r['forma_id'])][str(d)] = float(r['total_recebimento'] or 0)
+
+    validas = [o for o in (datas_obj[d] for v in vendas_band.values() for d in v) if o]
+    calendario = CalendarioUteis(feriados_set, min(validas), max(validas)) if validas else None
 
     report = []
     grand_total_venda = 0.0
@@ -517,14 +549,14 @@ def _build_report(bandeiras, vinculos_map, vendas_rows, recebimentos_rows, feria
             saldo_aplicavel = False
 
         # Todas as datas de venda desta bandeira no período
-        sale_dates = sorted(d for (b, d) in vendas_idx if b == bid)
+        vendas_b = vendas_band.get(bid, {})
+        sale_dates = sorted(vendas_b)
 
         # Todas as datas de recebimento real no período
+        receb_b = [receb_forma.get(fid, {}) for fid in forma_ids]
         all_receipt_dates = set()
-        for fid in forma_ids:
-            for (fid2, d) in receb_idx:
-                if fid2 == fid:
-                    all_receipt_dates.add(d)
+        for receb_f in receb_b:
+            all_receipt_dates.update(receb_f)
 
         if not sale_dates and not all_receipt_dates and (saldo_anterior == 0.0 or not saldo_aplicavel):
             continue
@@ -537,9 +569,9 @@ def _build_report(bandeiras, vinculos_map, vendas_rows, recebimentos_rows, feria
         # a primeira segunda-feira do período, permitindo conferência correta.
         cycles = defaultdict(list)
         for sd in sale_dates:
-            sd_obj = _parse_iso(sd)
+            sd_obj = datas_obj[sd]
             if sd_obj:
-                rd_obj = sd_obj if prazo == 0 else _next_business_day(sd_obj, prazo, feriados_set)
+                rd_obj = calendario.somar(sd_obj, prazo)
                 # Ignora vendas pré-período cujo recebimento já ocorreu antes do período
                 if data_inicio_obj and rd_obj < data_inicio_obj:
                     continue
@@ -564,8 +596,8 @@ def _build_report(bandeiras, vinculos_map, vendas_rows, recebimentos_rows, feria
 
         for rd in sorted_cycle_dates:
             cycle_sale_dates = sorted(cycles[rd])
-            actual_receipt = sum(receb_idx.get((fid, rd), 0.0) for fid in forma_ids)
-            cycle_venda = sum(vendas_idx.get((bid, sd), 0.0) for sd in cycle_sale_dates)
+            actual_receipt = sum(receb_f.get(rd, 0.0) for receb_f in receb_b)
+            cycle_venda = sum(vendas_b.get(sd, 0.0) for sd in cycle_sale_dates)
 
             # No 1º ciclo: se o saldo_anterior for aplicável para o período consultado,
             # soma-o às vendas efetivas (pré-período pendentes de liquidação no 1º recebimento).
@@ -583,7 +615,7 @@ def _build_report(bandeiras, vinculos_map, vendas_rows, recebimentos_rows, feria
             cycle_fee = (effective_sales - actual_receipt) if has_receipt else 0.0
             pct = (cycle_fee / effective_sales * 100) if (has_receipt and effective_sales) else None
 
-            rd_obj = _parse_iso(rd)
+            rd_obj = datas_obj[rd]
             dia_semana_rd = _DIAS_PT[rd_obj.weekday()] if rd_obj else ''
             num_sale_rows = len(cycle_sale_dates)
 
@@ -596,7 +628,7 @@ def _build_report(bandeiras, vinculos_map, vendas_rows, recebimentos_rows, feria
                 linhas.append({
                     'data_venda': '',
                     'total_venda': 0.0,
-                    'data_recebimento': _fmt_date(rd) if has_receipt else '',
+                    'data_recebimento': datas_fmt[rd] if has_receipt else '',
                     'total_recebimento': actual_receipt,
                     'diferenca': -actual_receipt if has_receipt else None,
                     'saldo_acumulado': saldo if has_receipt else None,
@@ -613,10 +645,10 @@ def _build_report(bandeiras, vinculos_map, vendas_rows, recebimentos_rows, feria
                     total_diferenca += cycle_fee
 
                 for i, sd in enumerate(cycle_sale_dates):
-                    venda = vendas_idx.get((bid, sd), 0.0)
+                    venda = vendas_b.get(sd, 0.0)
                     is_last = (i == num_sale_rows - 1)
 
-                    sd_obj = _parse_iso(sd)
+                    sd_obj = datas_obj[sd]
                     dia_semana_sd = _DIAS_PT[sd_obj.weekday()] if sd_obj else ''
                     is_destaque = (sd_obj is not None and sd_obj.weekday() >= 5) or (sd in feriados_set)
                     is_preperiodo = data_inicio_obj is not None and sd_obj is not None and sd_obj < data_inicio_obj
@@ -625,9 +657,9 @@ def _build_report(bandeiras, vinculos_map, vendas_rows, recebimentos_rows, feria
                         # Última venda do ciclo: exibe recebimento, diferença, DIF e %
                         # Sempre mostra a data de recebimento esperada (mesmo sem recebimento)
                         linhas.append({
-                            'data_venda': _fmt_date(sd),
+                            'data_venda': datas_fmt[sd],
                             'total_venda': venda,
-                            'data_recebimento': _fmt_date(rd),
+                            'data_recebimento': datas_fmt[rd],
                             'total_recebimento': actual_receipt,
                             'diferenca': cycle_fee if has_receipt else None,
                             'saldo_acumulado': saldo if has_receipt else None,
@@ -641,9 +673,9 @@ def _build_report(bandeiras, vinculos_map, vendas_rows, recebimentos_rows, feria
                     else:
                         # Linhas intermediárias: mostra data esperada de recebimento, sem valor
                         linhas.append({
-                            'data_venda': _fmt_date(sd),
+                            'data_venda': datas_fmt[sd],
                             'total_venda': venda,
-                            'data_recebimento': _fmt_date(rd),
+                            'data_recebimento': datas_fmt[rd],
                             'total_recebimento': 0.0,
                             'diferenca': None,
                             'saldo_acumulado': None,
@@ -825,6 +857,7 @@ def config_contabil_salvar():
                 " WHERE bandeira_cartao_id = %s AND cliente_id = %s",
                 (bandeira_id, cliente_id),
             )
+        contas_contabeis.invalidar(cur)
         conn.commit()
         cur.close()
         return jsonify({'success': True})
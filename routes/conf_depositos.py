@@ -32,6 +32,7 @@ from flask_login import login_required
 
 from routes.auth import admin_required
 from utils.db import get_db_connection
+from utils.schema_registry import garantia
 
 bp = Blueprint('conf_depositos', __name__, url_prefix='/relatorios')
 
@@ -42,6 +43,7 @@ _DIAS_PT = ['Seg', 'Ter', 'Qua', 'Qui', 'Sex', 'Sáb', 'Dom']
 # DB setup / migration
 # ──────────────────────────────────────────────────────────────────────────────
 
+@garantia
 def _ensure_vinculos_table(conn):
     """
     Cria conf_depositos_vinculos (empresa_id × forma_recebimento_id × tipo_deposito).
@@ -127,7 +129,7 @@ def _ensure_vinculos_table(conn):
 
         cur.close()
     except Exception:
-        pass  # Não crítico — a tabela pode já estar correta
+        return False  # não crítico — a tabela pode já estar correta
 
 
 # ──────────────────────────────────────────────────────────────────────────────
@@ -20,33 +20,43 @@ adiantamento viraria diferença falsa a cada período.
 Rota:
   GET /relatorios/conf_fornecedores_dfe
 """
+import logging
+import time
 import xml.etree.ElementTree as ET
-from collections import defaultdict
+from collections import defaultdict, deque
 from datetime import date, datetime, timedelta
 
 from flask import Blueprint, jsonify, render_template, request
 from flask_login import current_user, login_required
 
 from routes.auth import admin_required
+from utils.cnpj_digitos import digitos
 from utils.db import get_db_connection
+from utils.schema_registry import garantia
 
 bp = Blueprint('conf_fornecedores_dfe', __name__, url_prefix='/relatorios')
 
+_log = logging.getLogger(__name__)
+
 
 # ──────────────────────────────────────────────────────────────────────────────
 # Pedaços de SQL reaproveitados
 # ──────────────────────────────────────────────────────────────────────────────
 
 # O CNPJ do cadastro vem de formulário e pode ter máscara; o da nota vem do XML
-# e é só dígito. Normaliza os dois lados antes de comparar.
-_CNPJ_FORN = "LPAD(REPLACE(REPLACE(REPLACE(REPLACE(f.cnpj,'.',''),'/',''),'-',''),' ',''),14,'0')"
+# e é só dígito. O lado do cadastro sai sem máscara de digitos(): a coluna
+# gerada `cnpj_digitos` quando o banco já a tem (utils/cnpj_digitos.py).
 _CNPJ_NOTA = "LPAD(d.emit_cnpj,14,'0')"
 
 
+def _cnpj_forn():
+    """O CNPJ do cadastro `f`, sem máscara e com 14 dígitos."""
+    return "LPAD(%s,14,'0')" % digitos('fornecedores', 'f')
+
+
 def _raiz_de(alias):
     """Os 8 primeiros dígitos do CNPJ do cadastro `alias` — a raiz da empresa."""
-    return ("LEFT(LPAD(REPLACE(REPLACE(REPLACE(REPLACE({a}.cnpj,'.',''),'/',''),"
-            "'-',''),' ',''),14,'0'),8)").format(a=alias)
+    return "LEFT(LPAD(%s,14,'0'),8)" % digitos('fornecedores', alias)
 
 
 # ─── RAIZ E GRUPO ─────────────────────────────────────────────────────────────
@@ -62,7 +72,6 @@ def _raiz_de(alias):
 # DISTRIBUIDORA RODOBRAS (raízes 57.370.381 e 33.777.842). Para esses,
 # fornecedor_grupo_raiz aponta cada raiz do grupo para um fornecedor TITULAR e
 # o relatório trata o grupo inteiro como um fornecedor só.
-_RAIZ_FORN = _raiz_de('f')
 _RAIZ_NOTA = "LEFT(%s,8)" % _CNPJ_NOTA
 
 # Mapa raiz -> fornecedor que representa o grupo, usado como tabela derivada em
@@ -73,20 +82,20 @@ _RAIZ_NOTA = "LEFT(%s,8)" % _CNPJ_NOTA
 # As raízes vêm de DOIS lugares e o UNION é obrigatório: só o cadastro deixaria
 # de fora a raiz que ninguém cadastrou — justamente a DISTRIBUIDORA RODOBRAS,
 # que emite a nota enquanto o dinheiro sai para a irmã cadastrada.
-_MAPA = """(
+def _mapa():
+    return """(
         SELECT r.raiz AS raiz, COALESCE(g.titular_id, r.id) AS forn_id
           FROM (SELECT u.raiz AS raiz, MIN(u.id) AS id
-                  FROM (SELECT LEFT(LPAD(REPLACE(REPLACE(REPLACE(REPLACE(fz.cnpj,'.',''),
-                                     '/',''),'-',''),' ',''),14,'0'),8) AS raiz,
+                  FROM (SELECT %s AS raiz,
                                fz.id AS id
                           FROM fornecedores fz
-                         WHERE fz.cnpj IS NOT NULL AND fz.cnpj <> ''
+                         WHERE %s <> ''
                         UNION ALL
                         SELECT gz.raiz AS raiz, gz.titular_id AS id
                           FROM fornecedor_grupo_raiz gz) u
                  GROUP BY u.raiz) r
           LEFT JOIN fornecedor_grupo_raiz g ON g.raiz = r.raiz
-      ) m"""
+      ) m""" % (_raiz_de('fz'), digitos('fornecedores', 'fz'))
 
 # Junta o mapa ao cadastro titular. Vem depois de uma tabela que já exponha a
 # raiz a comparar — por isso cada consulta diz com o que `m.raiz` casa.
@@ -242,6 +251,7 @@ _SQL_DUP_MANUAL = (
 )
 
 
+@garantia
 def _garante_coluna_manual(conn):
     """Cria dfe_documentos.entrada_manual se faltar. Só adiciona; default 0.
 
@@ -260,6 +270,7 @@ def _garante_coluna_manual(conn):
     cur.close()
 
 
+@garantia
 def _garante_coluna_pago_antes(conn):
     """Cria as colunas do "antes do corte" se faltarem. So adiciona.
 
@@ -298,6 +309,7 @@ CREATE TABLE IF NOT EXISTS dfe_nota_lancamento (
 """
 
 
+@garantia
 def _garante_tabela_nota_lanc(conn):
     """Cria dfe_nota_lancamento se faltar.
 
@@ -311,6 +323,7 @@ def _garante_tabela_nota_lanc(conn):
     cur.close()
 
 
+@garantia
 def _garante_tabela_pg_pre_corte(conn):
     """Cria dfe_pagamento_pre_corte se faltar. Tabela propria de proposito:
     bank_transactions e do modulo do banco inteiro — esta marca ("liquidou
@@ -343,7 +356,7 @@ def _pagamentos_ocultos(conn, empresa_ids, fornecedor_ids):
           JOIN %s ON m.raiz = %s
          WHERE %s
          ORDER BY bt.data_transacao
-    """ % (_MAPA, _raiz_de('fp'), " AND ".join(where)), params)
+    """ % (_mapa(), _raiz_de('fp'), " AND ".join(where)), params)
     rows = cur.fetchall()
     cur.close()
     saida = defaultdict(list)
@@ -397,15 +410,15 @@ def _lancamentos_por_raiz(conn, data_ini, data_fim):
     """
     cur = conn.cursor(dictionary=True)
     cur.execute("""
-        SELECT LEFT(LPAD(REPLACE(REPLACE(REPLACE(bt.cnpj_cpf,'.',''),'/',''),
-                                 '-',''),14,'0'),8) AS raiz,
+        SELECT LEFT(LPAD(__BT__,14,'0'),8) AS raiz,
                COUNT(*) AS n, COALESCE(SUM(ld.valor),0) AS total
           FROM lancamentos_despesas ld
           JOIN bank_transactions bt ON bt.id = ld.bank_transaction_id
          WHERE ld.data BETWEEN %s AND %s
-           AND bt.cnpj_cpf IS NOT NULL AND bt.cnpj_cpf <> ''
+           AND __BT__ <> ''
          GROUP BY 1
-    """, (data_ini, data_fim))
+    """.replace('__BT__', digitos('bank_transactions', 'bt', 'cnpj_cpf')),
+                (data_ini, data_fim))
     rows = cur.fetchall()
     cur.close()
     return {r['raiz']: {'n': int(r['n']), 'total': float(r['total'] or 0)}
@@ -494,7 +507,7 @@ def _notas_ocultas(conn, empresa_ids, fornecedor_ids):
           JOIN %s ON m.raiz = %s
          WHERE %s
          ORDER BY d.dh_emissao
-    """ % (_MAPA, _RAIZ_NOTA, " AND ".join(where)), params)
+    """ % (_mapa(), _RAIZ_NOTA, " AND ".join(where)), params)
     rows = cur.fetchall()
     cur.close()
     saida = defaultdict(list)
@@ -505,6 +518,7 @@ def _notas_ocultas(conn, empresa_ids, fornecedor_ids):
     return dict(saida)
 
 
+@garantia
 def _garante_tabela_grupo(conn):
     """Cria fornecedor_grupo_raiz se faltar. Só cria — não altera nem apaga."""
     cur = conn.cursor()
@@ -628,7 +642,7 @@ def _mapa_cadastros(conn):
           FROM fornecedores f
           JOIN __MAPA__ ON m.raiz = __RAIZ_F__
          ORDER BY (f.id = m.forn_id) DESC, f.razao_social
-    """.replace('__MAPA__', _MAPA).replace('__RAIZ_F__', _RAIZ_FORN))
+    """.replace('__MAPA__', _mapa()).replace('__RAIZ_F__', _raiz_de('f')))
     rows = cur.fetchall()
     cur.close()
 
@@ -652,7 +666,7 @@ def _mapa_cadastros(conn):
           FROM fornecedor_grupo_raiz g
          WHERE NOT EXISTS (SELECT 1 FROM fornecedores f
                             WHERE __RAIZ_F__ = g.raiz)
-    """.replace('__RAIZ_F__', _RAIZ_FORN))
+    """.replace('__RAIZ_F__', _raiz_de('f')))
     for r in cur.fetchall():
         nome = (r['emit_nome'] or '').strip()
         raizes[r['titular_id']].add(r['raiz'])
@@ -674,18 +688,18 @@ def _cnpjs_duplicados(conn):
          WHERE f.cnpj IS NOT NULL AND f.cnpj <> ''
          GROUP BY %s
         HAVING COUNT(*) > 1
-    """ % (_CNPJ_FORN, _CNPJ_FORN))
+    """ % (_cnpj_forn(), _cnpj_forn()))
     rows = cur.fetchall()
     cur.close()
     return rows
 
 
-def _notas_anteriores(conn, data_ini, empresa_ids, fornecedor_ids):
-    """Notas entre o CORTE e o início do período (é o saldo de trás)."""
+def _notas_anteriores(conn, data_ini, empresa_ids, fornecedor_ids, desde=DATA_CORTE_DFE):
+    """Notas entre `desde` (o CORTE) e o início do período (é o saldo de trás)."""
     # Nota trazida à mão NUNCA entra aqui: ela aparece como linha no período
     # (mesmo sendo mais velha). Contar nos dois lugares dobraria a dívida.
     where = [_FILTRO_NOTA, "d.entrada_manual = 0", "d.dh_emissao >= %s", "d.dh_emissao < %s"]
-    params = [DATA_CORTE_DFE + " 00:00:00", data_ini + " 00:00:00"]
+    params = [desde + " 00:00:00", data_ini + " 00:00:00"]
     _em("d.cliente_id", empresa_ids, where, params)
     _em("m.forn_id", fornecedor_ids, where, params)
 
@@ -696,18 +710,18 @@ def _notas_anteriores(conn, data_ini, empresa_ids, fornecedor_ids):
           JOIN %s ON m.raiz = %s
          WHERE %s
          GROUP BY m.forn_id
-    """ % (_MAPA, _RAIZ_NOTA, " AND ".join(where)), params)
+    """ % (_mapa(), _RAIZ_NOTA, " AND ".join(where)), params)
     rows = cur.fetchall()
     cur.close()
     return {r['fornecedor_id']: float(r['total'] or 0) for r in rows}
 
 
-def _pagamentos_anteriores(conn, data_ini, empresa_ids, fornecedor_ids):
+def _pagamentos_anteriores(conn, data_ini, empresa_ids, fornecedor_ids, desde=DATA_CORTE_DFE):
     where = ["bt.tipo = 'DEBIT'", "bt.fornecedor_id IS NOT NULL",
              "bt.data_transacao >= %s", "bt.data_transacao < %s",
              """NOT EXISTS (SELECT 1 FROM dfe_pagamento_pre_corte pc
                              WHERE pc.transacao_id = bt.id)"""]
-    params = [DATA_CORTE_DFE, data_ini]
+    params = [desde, data_ini]
     _em("ba.cliente_id", empresa_ids, where, params)
     _em("m.forn_id", fornecedor_ids, where, params)
 
@@ -720,7 +734,7 @@ def _pagamentos_anteriores(conn, data_ini, empresa_ids, fornecedor_ids):
           JOIN %s ON m.raiz = %s
          WHERE %s
          GROUP BY m.forn_id
-    """ % (_MAPA, _raiz_de('fp'), " AND ".join(where)), params)
+    """ % (_mapa(), _raiz_de('fp'), " AND ".join(where)), params)
     rows = cur.fetchall()
     cur.close()
     return {r['fornecedor_id']: float(r['total'] or 0) for r in rows}
@@ -765,7 +779,7 @@ def _notas_periodo(conn, data_ini, data_fim, empresa_ids, fornecedor_ids):
           LEFT JOIN clientes emp ON emp.id = d.cliente_id
          WHERE %s
          ORDER BY d.dh_emissao, d.id
-    """ % (_MAPA, _RAIZ_NOTA, _JOIN_TITULAR, " AND ".join(where)), params)
+    """ % (_mapa(), _RAIZ_NOTA, _JOIN_TITULAR, " AND ".join(where)), params)
     rows = cur.fetchall()
     cur.close()
     return rows
@@ -795,7 +809,7 @@ def _pagamentos_periodo(conn, data_ini, data_fim, empresa_ids, fornecedor_ids):
           LEFT JOIN clientes emp ON emp.id = ba.cliente_id
          WHERE %s
          ORDER BY bt.data_transacao, bt.id
-    """ % (_MAPA, _raiz_de('fp'), _JOIN_TITULAR, " AND ".join(where)), params)
+    """ % (_mapa(), _raiz_de('fp'), _JOIN_TITULAR, " AND ".join(where)), params)
     rows = cur.fetchall()
     cur.close()
     return rows
@@ -825,19 +839,19 @@ def _devolucoes_periodo(conn, data_ini, data_fim, empresa_ids, fornecedor_ids):
           %s
          WHERE %s
          ORDER BY bt.data_transacao, bt.id
-    """ % (_MAPA, _raiz_de('fp'), _JOIN_TITULAR, " AND ".join(where)), params)
+    """ % (_mapa(), _raiz_de('fp'), _JOIN_TITULAR, " AND ".join(where)), params)
     rows = cur.fetchall()
     cur.close()
     return rows
 
 
-def _devolucoes_anteriores(conn, data_ini, empresa_ids, fornecedor_ids):
+def _devolucoes_anteriores(conn, data_ini, empresa_ids, fornecedor_ids, desde=DATA_CORTE_DFE):
     """Devolucao entre o corte e o inicio do periodo abate o pago de tras."""
     where = ["bt.tipo = 'CREDIT'",
              "bt.tipo_conciliacao = 'devolucao_fornecedor'",
              "bt.fornecedor_id IS NOT NULL",
              "bt.data_transacao >= %s", "bt.data_transacao < %s"]
-    params = [DATA_CORTE_DFE, data_ini]
+    params = [desde, data_ini]
     _em("ba.cliente_id", empresa_ids, where, params)
     _em("m.forn_id", fornecedor_ids, where, params)
 
@@ -850,12 +864,311 @@ def _devolucoes_anteriores(conn, data_ini, empresa_ids, fornecedor_ids):
           JOIN %s ON m.raiz = %s
          WHERE %s
          GROUP BY m.forn_id
-    """ % (_MAPA, _raiz_de('fp'), " AND ".join(where)), params)
+    """ % (_mapa(), _raiz_de('fp'), " AND ".join(where)), params)
     rows = cur.fetchall()
     cur.close()
     return {r['fornecedor_id']: float(r['total'] or 0) for r in rows}
 
 
+# ─── RAZÃO MENSAL (saldo de trás) ─────────────────────────────────────────────
+# O saldo anterior somava TODO o histórico, do corte até a véspera do período,
+# em três consultas a cada abertura da tela. dfe_razao_fornecedor guarda esse
+# movimento já somado por (mês, empresa, raiz do CNPJ) — notas, pagamentos e
+# devoluções com os MESMOS filtros das três funções acima. O saldo de trás vira
+# a soma dos meses inteiros no razão + o pedaço do mês de data_ini até a
+# véspera, ao vivo (janela de no máximo um mês).
+#
+# Pela RAIZ e não pelo fornecedor: agrupar/desagrupar só muda o _mapa(), que é
+# aplicado na leitura — o razão não precisa ser refeito.
+#
+# Quem suja um mês são gatilhos (_gatilhos_razao), não as rotas: a nota chega
+# pela captura (scripts/processa_dfe), a classificação dos itens decide se ela
+# é compra, e fornecedor_id/devolução são gravados em dezenas de lugares da
+# conciliação. Os gatilhos são criados na partida (app._ensure_lucro_postos_tables),
+# nunca numa request, e anotam em dfe_razao_marcas o mês da linha (antes e
+# depois da alteração); CNPJ de fornecedor ou empresa de conta bancária
+# alterados sujam todos os meses. A tela passa as marcas para dfe_razao_meses
+# e refaz só os meses sujos antes de ler.
+# Vínculo manual pagamento × nota não entra: muda o rateio, não o saldo.
+#
+# Marca em tabela só de INSERT, e não direto em dfe_razao_meses: a importação
+# de um OFX grava centenas de linhas do mesmo mês numa transação só, e o
+# upsert na linha do mês prendia essa linha até o commit — duas importações
+# (ou a conciliação ao lado) ficavam em fila nela.
+#
+# Corrida: como em dashboard_metricas, o recálculo lê `versao` antes e grava
+# sujo = (versao mudou) — gravação feita no meio do recálculo não se perde
+# (a marca dela só é absorvida depois e suja o mês de novo).
+
+_MARCA_MESES = """INSERT INTO dfe_razao_marcas (ano_mes)
+    SELECT x.ano_mes FROM ({meses}) x WHERE x.ano_mes IS NOT NULL"""
+_MES_DA_LINHA = "SELECT DATE_FORMAT({data}, '%Y-%m') AS ano_mes FROM DUAL WHERE {cond}"
+_SUJA_TUDO = "UPDATE dfe_razao_meses SET sujo = 1, versao = versao + 1"
+
+# tabela -> (data do movimento, linha que conta, colunas que mudam o saldo)
+_ORIGENS_RAZAO = {
+    'bank_transactions': (
+        "{r}.data_transacao", "{r}.fornecedor_id IS NOT NULL",
+        ('fornecedor_id', 'valor', 'data_transacao', 'tipo', 'tipo_conciliacao', 'account_id')),
+    'dfe_documentos': (
+        "{r}.dh_emissao", "{r}.tipo = 'NFe'",
+        ('tipo', 'situacao', 'pago_antes_corte', 'entrada_manual', 'dh_emissao',
+         'valor_total', 'emit_cnpj', 'cliente_id')),
+    'dfe_itens': (
+        "(SELECT dz.dh_emissao FROM dfe_documentos dz WHERE dz.id = {r}.documento_id)", "TRUE",
+        ('categoria', 'documento_id')),
+    'dfe_pagamento_pre_corte': (
+        "(SELECT bz.data_transacao FROM bank_transactions bz WHERE bz.id = {r}.transacao_id)", "TRUE",
+        ('transacao_id',)),
+}
+# tabela -> coluna que, alterada, muda a raiz/empresa de meses inteiros
+_ORIGENS_RAZAO_TUDO = {'fornecedores': 'cnpj', 'bank_accounts': 'cliente_id'}
+
+
+def _gatilhos_razao():
+    """(nome, CREATE TRIGGER) dos gatilhos que sujam o razão."""
+    out = []
+    for tabela, (data, cond, colunas) in _ORIGENS_RAZAO.items():
+        mudou = "NOT (%s)" % " AND ".join("OLD.{c} <=> NEW.{c}".format(c=c) for c in colunas)
+        for evento, linhas in (('INSERT', ('NEW',)),
+                               ('UPDATE', ('OLD', 'NEW')),
+                               ('DELETE', ('OLD',))):
+            meses = " UNION ".join(
+                _MES_DA_LINHA.format(
+                    data=data.format(r=r),
+                    cond=cond.format(r=r) + (" AND " + mudou if evento == 'UPDATE' else ""))
+                for r in linhas)
+            out.append(("razao_dfe_%s_%s" % (tabela, evento.lower()),
+                        "CREATE TRIGGER `razao_dfe_%s_%s` AFTER %s ON `%s` FOR EACH ROW %s"
+                        % (tabela, evento.lower(), evento, tabela,
+                           _MARCA_MESES.format(meses=meses))))
+    for tabela, coluna in _ORIGENS_RAZAO_TUDO.items():
+        for evento, onde in (('UPDATE', " WHERE NOT (OLD.{c} <=> NEW.{c})".format(c=coluna)),
+                             ('DELETE', "")):
+            out.append(("razao_dfe_%s_%s" % (tabela, evento.lower()),
+                        "CREATE TRIGGER `razao_dfe_%s_%s` AFTER %s ON `%s` FOR EACH ROW %s%s"
+                        % (tabela, evento.lower(), evento, tabela, _SUJA_TUDO, onde)))
+    return out
+
+
+_DDL_RAZAO = ("""
+CREATE TABLE IF NOT EXISTS dfe_razao_fornecedor (
+  ano_mes     CHAR(7)       NOT NULL,
+  cliente_id  INT           NOT NULL,
+  raiz        CHAR(8)       NOT NULL,
+  notas       DECIMAL(18,2) NOT NULL DEFAULT 0,
+  pagamentos  DECIMAL(18,2) NOT NULL DEFAULT 0,
+  devolucoes  DECIMAL(18,2) NOT NULL DEFAULT 0,
+  PRIMARY KEY (ano_mes, cliente_id, raiz),
+  KEY ix_raiz (raiz)
+)
+""", """
+CREATE TABLE IF NOT EXISTS dfe_razao_meses (
+  ano_mes        CHAR(7)  NOT NULL PRIMARY KEY,
+  sujo           TINYINT  NOT NULL DEFAULT 1,
+  versao         INT      NOT NULL DEFAULT 0,
+  atualizado_em  DATETIME NULL
+)
+""", """
+CREATE TABLE IF NOT EXISTS dfe_razao_marcas (
+  id       BIGINT  NOT NULL AUTO_INCREMENT PRIMARY KEY,
+  ano_mes  CHAR(7) NOT NULL
+)
+""")
+
+
+# Gatilhos ausentes (partida ainda rodando, ou sem privilégio de TRIGGER)
+# ficam lembrados neste processo por esse tempo, para a tela não consultar o
+# information_schema a cada abertura.
+_RAZAO_RETENTAR_SEG = 60
+_razao_falhou_em = None
+_razao_ativo = False
+
+
+def _gatilhos_razao_ativos(conn):
+    """True quando todos os gatilhos do razão existem. Só lê: quem cria é a
+    partida. Sem eles a tela volta às três consultas sobre o histórico inteiro
+    e só olha de novo depois de _RAZAO_RETENTAR_SEG."""
+    global _razao_ativo, _razao_falhou_em
+    if _razao_ativo:
+        return True
+    if (_razao_falhou_em is not None
+            and time.monotonic() - _razao_falhou_em < _RAZAO_RETENTAR_SEG):
+        return False
+    nomes = [nome for nome, _ddl in _gatilhos_razao()]
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT COUNT(*) FROM information_schema.TRIGGERS"
+                    " WHERE TRIGGER_SCHEMA = DATABASE() AND TRIGGER_NAME IN (%s)"
+                    % ", ".join(["%s"] * len(nomes)), nomes)
+        _razao_ativo = cur.fetchone()[0] == len(nomes)
+    except Exception:
+        _log.warning("conf_fornecedores_dfe: não consegui ler os gatilhos do razão.",
+                     exc_info=True)
+    finally:
+        cur.close()
+    if not _razao_ativo:
+        _log.warning("conf_fornecedores_dfe: gatilhos do razão ausentes; "
+                     "saldo de trás ao vivo por %ds.", _RAZAO_RETENTAR_SEG)
+        _razao_falhou_em = time.monotonic()
+    return _razao_ativo
+
+
+_RAZAO_NOTAS = """
+    INSERT INTO dfe_razao_fornecedor (ano_mes, cliente_id, raiz, notas)
+    SELECT %s, COALESCE(d.cliente_id,0), __RAIZ__, COALESCE(SUM(d.valor_total),0)
+      FROM dfe_documentos d
+     WHERE __FILTRO__ AND d.entrada_manual = 0 AND d.emit_cnpj IS NOT NULL
+       AND d.dh_emissao >= %s AND d.dh_emissao < %s
+     GROUP BY COALESCE(d.cliente_id,0), __RAIZ__
+    ON DUPLICATE KEY UPDATE notas = VALUES(notas)
+""".replace('__FILTRO__', _FILTRO_NOTA).replace('__RAIZ__', _RAIZ_NOTA)
+
+_RAZAO_BANCO = """
+    INSERT INTO dfe_razao_fornecedor (ano_mes, cliente_id, raiz, __COLUNA__)
+    SELECT %s, COALESCE(ba.cliente_id,0), __RAIZ__, COALESCE(SUM(bt.valor),0)
+      FROM bank_transactions bt
+      JOIN bank_accounts ba ON ba.id = bt.account_id
+      JOIN fornecedores fp  ON fp.id = bt.fornecedor_id
+     WHERE __FILTRO__ AND bt.fornecedor_id IS NOT NULL AND fp.cnpj IS NOT NULL
+       AND bt.data_transacao >= %s AND bt.data_transacao < %s
+     GROUP BY COALESCE(ba.cliente_id,0), __RAIZ__
+    ON DUPLICATE KEY UPDATE __COLUNA__ = VALUES(__COLUNA__)
+"""
+
+_RAZAO_PAGAMENTOS = (_RAZAO_BANCO.replace('__COLUNA__', 'pagamentos')
+                     .replace('__FILTRO__', """bt.tipo = 'DEBIT'
+       AND NOT EXISTS (SELECT 1 FROM dfe_pagamento_pre_corte pc
+                        WHERE pc.transacao_id = bt.id)"""))
+_RAZAO_DEVOLUCOES = (_RAZAO_BANCO.replace('__COLUNA__', 'devolucoes')
+                     .replace('__FILTRO__', """bt.tipo = 'CREDIT'
+       AND bt.tipo_conciliacao = 'devolucao_fornecedor'"""))
+
+
+def _meses_inteiros(desde, ate):
+    """'AAAA-MM' de cada mês do de `desde` até o ANTERIOR ao de `ate`."""
+    ano, mes = int(desde[:4]), int(desde[5:7])
+    fim = ate[:7]
+    meses = []
+    while '%04d-%02d' % (ano, mes) < fim:
+        meses.append('%04d-%02d' % (ano, mes))
+        ano, mes = (ano + 1, 1) if mes == 12 else (ano, mes + 1)
+    return meses
+
+
+def _razao_recalcula_mes(conn, ano_mes):
+    """Refaz as linhas do razão de um mês (a partir do corte, no mês dele)."""
+    ano, mes = int(ano_mes[:4]), int(ano_mes[5:7])
+    ini = max(ano_mes + '-01', DATA_CORTE_DFE)
+    fim = '%04d-%02d-01' % ((ano + 1, 1) if mes == 12 else (ano, mes + 1))
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT versao FROM dfe_razao_meses WHERE ano_mes = %s", (ano_mes,))
+        row = cur.fetchone()
+        lida = row[0] if row else 0
+        cur.execute("DELETE FROM dfe_razao_fornecedor WHERE ano_mes = %s", (ano_mes,))
+        cur.execute(_RAZAO_NOTAS, (ano_mes, ini + " 00:00:00", fim + " 00:00:00"))
+        raiz = _raiz_de('fp')
+        cur.execute(_RAZAO_PAGAMENTOS.replace('__RAIZ__', raiz), (ano_mes, ini, fim))
+        cur.execute(_RAZAO_DEVOLUCOES.replace('__RAIZ__', raiz), (ano_mes, ini, fim))
+        cur.execute("""INSERT INTO dfe_razao_meses (ano_mes, sujo, versao, atualizado_em)
+                       VALUES (%s, 0, 0, NOW())
+                       ON DUPLICATE KEY UPDATE sujo = IF(versao = %s, 0, 1),
+                                               atualizado_em = NOW()""", (ano_mes, lida))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def _razao_absorve_marcas(conn):
+    """Passa as marcas dos gatilhos para dfe_razao_meses (suja e sobe a
+    versão de cada mês marcado) e apaga as absorvidas. Marca gravada depois
+    do MAX(id) fica para a próxima leitura."""
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT MAX(id) FROM dfe_razao_marcas")
+        row = cur.fetchone()
+        ate = row[0] if row else None
+        if not ate:
+            return
+        cur.execute("""INSERT INTO dfe_razao_meses (ano_mes, sujo, versao, atualizado_em)
+                       SELECT DISTINCT ano_mes, 1, 1, NOW()
+                         FROM dfe_razao_marcas WHERE id <= %s
+                       ON DUPLICATE KEY UPDATE sujo = 1, versao = versao + 1""", (ate,))
+        cur.execute("DELETE FROM dfe_razao_marcas WHERE id <= %s", (ate,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def _razao_saldos(conn, meses, empresa_ids, fornecedor_ids):
+    """(notas, pagos − devoluções) por fornecedor nos `meses` do razão,
+    refazendo antes os que estiverem sujos ou ainda não calculados."""
+    _razao_absorve_marcas(conn)
+    cur = conn.cursor()
+    cur.execute("""SELECT ano_mes FROM dfe_razao_meses
+                    WHERE ano_mes >= %s AND ano_mes <= %s AND sujo = 0""",
+                (meses[0], meses[-1]))
+    limpos = {r[0] for r in cur.fetchall()}
+    cur.close()
+    for mes in meses:
+        if mes not in limpos:
+            _razao_recalcula_mes(conn, mes)
+
+    where = ["r.ano_mes >= %s", "r.ano_mes <= %s"]
+    params = [meses[0], meses[-1]]
+    _em("r.cliente_id", empresa_ids, where, params)
+    _em("m.forn_id", fornecedor_ids, where, params)
+    cur = conn.cursor(dictionary=True)
+    cur.execute("""
+        SELECT m.forn_id AS fornecedor_id, SUM(r.notas) AS notas,
+               SUM(r.pagamentos - r.devolucoes) AS pagos
+          FROM dfe_razao_fornecedor r
+          JOIN %s ON m.raiz = r.raiz
+         WHERE %s
+         GROUP BY m.forn_id
+    """ % (_mapa(), " AND ".join(where)), params)
+    rows = cur.fetchall()
+    cur.close()
+    return ({r['fornecedor_id']: float(r['notas'] or 0) for r in rows},
+            {r['fornecedor_id']: float(r['pagos'] or 0) for r in rows})
+
+
+def _saldos_anteriores(conn, data_ini, empresa_ids, fornecedor_ids):
+    """(notas_ant, pagos_ant) por fornecedor, do corte até a véspera de
+    data_ini — pagos_ant já sem as devoluções. Meses inteiros vêm do razão;
+    o começo do mês de data_ini, das consultas ao vivo."""
+    notas_ant, pagos_ant = {}, {}
+    desde = DATA_CORTE_DFE
+    meses = _meses_inteiros(DATA_CORTE_DFE, data_ini)
+    if meses and _gatilhos_razao_ativos(conn):
+        try:
+            notas_ant, pagos_ant = _razao_saldos(conn, meses, empresa_ids, fornecedor_ids)
+            desde = data_ini[:8] + '01'
+        except Exception:
+            _log.warning("conf_fornecedores_dfe: razão indisponível; saldo de trás ao vivo.",
+                         exc_info=True)
+            conn.rollback()
+            notas_ant, pagos_ant = {}, {}
+    if desde < data_ini:
+        for fid, v in _notas_anteriores(conn, data_ini, empresa_ids, fornecedor_ids,
+                                        desde).items():
+            notas_ant[fid] = notas_ant.get(fid, 0.0) + v
+        for fid, v in _pagamentos_anteriores(conn, data_ini, empresa_ids, fornecedor_ids,
+                                             desde).items():
+            pagos_ant[fid] = pagos_ant.get(fid, 0.0) + v
+        for fid, v in _devolucoes_anteriores(conn, data_ini, empresa_ids, fornecedor_ids,
+                                             desde).items():
+            pagos_ant[fid] = pagos_ant.get(fid, 0.0) - v
+    return notas_ant, pagos_ant
+
+
 _DDL_VINCULO = """
 CREATE TABLE IF NOT EXISTS dfe_pagamento_nota (
     id            INT AUTO_INCREMENT PRIMARY KEY,
@@ -871,6 +1184,7 @@ CREATE TABLE IF NOT EXISTS dfe_pagamento_nota (
 """
 
 
+@garantia
 def _garante_tabela_vinculo(conn):
     """Cria a tabela do vínculo se ainda não existir.
 
@@ -901,13 +1215,23 @@ def _tem_tabela_vinculo(conn):
 
 
 def _canonico_do_cnpj(conn, cnpj):
-    """Qual fornecedor representa este CNPJ (pela raiz, respeitando o grupo)."""
+    """Qual fornecedor representa este CNPJ (pela raiz, respeitando o grupo).
+
+    Mesma regra do _mapa(), só que para UMA raiz: o titular do grupo, se houver;
+    senão o menor id cadastrado com a raiz. Não monta o mapa inteiro.
+    """
     if not cnpj:
         return None
+    raiz = _so_digitos(cnpj).rjust(14, '0')[:8]
     cur = conn.cursor()
-    cur.execute("""SELECT m.forn_id FROM __MAPA__
-                    WHERE m.raiz = LEFT(LPAD(%s,14,'0'),8)"""
-                .replace('__MAPA__', _MAPA), (cnpj,))
+    cur.execute("""SELECT COALESCE(
+                       (SELECT g.titular_id FROM fornecedor_grupo_raiz g
+                         WHERE g.raiz = %%s),
+                       (SELECT MIN(fz.id) FROM fornecedores fz
+                         WHERE %s <> ''
+                           AND %s = %%s))"""
+                % (digitos('fornecedores', 'fz'), _raiz_de('fz')),
+                (raiz, raiz))
     row = cur.fetchone()
     cur.close()
     return row[0] if row else None
@@ -1010,7 +1334,7 @@ def _pagamentos_vinculados_fora(conn, doc_ids, data_ini, data_fim):
          WHERE v.documento_id IN (__IDS__)
            AND (bt.data_transacao < %s OR bt.data_transacao > %s)
          ORDER BY bt.data_transacao, bt.id
-    """.replace('__IDS__', ph).replace('__MAPA__', _MAPA) \
+    """.replace('__IDS__', ph).replace('__MAPA__', _mapa()) \
        .replace('__RAIZ_FP__', _raiz_de('fp')) \
        .replace('__JOIN_TITULAR__', _JOIN_TITULAR)
 
@@ -1047,7 +1371,7 @@ def _pagamentos_antes_do_corte(conn, empresa_ids, fornecedor_ids):
           JOIN %s ON m.raiz = %s
          WHERE %s
          ORDER BY bt.data_transacao DESC, bt.id DESC
-    """ % (_MAPA, _raiz_de('fp'), " AND ".join(where)), params)
+    """ % (_mapa(), _raiz_de('fp'), " AND ".join(where)), params)
     rows = cur.fetchall()
     cur.close()
 
@@ -1097,7 +1421,7 @@ def _notas_sem_fornecedor(conn, data_ini, data_fim, empresa_ids):
          WHERE %s
          GROUP BY d.emit_cnpj, d.emit_nome
          ORDER BY total DESC
-    """ % (_MAPA, _RAIZ_NOTA, " AND ".join(where)), params)
+    """ % (_mapa(), _RAIZ_NOTA, " AND ".join(where)), params)
     rows = cur.fetchall()
     cur.close()
     return rows
@@ -1133,6 +1457,12 @@ def _aloca_fifo(linhas, saldo_anterior):
 
     Marca cada nota com `falta` (0 = coberta) e devolve (sobra, descoberto).
     Invariante: sobra − descoberto == saldo do período + saldo anterior.
+
+    As notas em aberto ficam num deque na ordem de entrada. O pagamento só
+    cobre notas da frente: a que fica coberta sai com popleft, a primeira que
+    não fecha esgota o caixa e o laço para. Cada nota sai uma vez só — O(1)
+    amortizado por nota, em vez de refazer a lista a cada pagamento. Mesmas
+    contas, na mesma ordem, da versão antiga (scripts/bench_conf_fornecedores_dfe.py).
     """
     # Saldo anterior positivo é dinheiro disponível; negativo é nota velha em
     # aberto que não está na lista (fora do período), mas precisa continuar
@@ -1140,9 +1470,10 @@ def _aloca_fifo(linhas, saldo_anterior):
     caixa = max(saldo_anterior, 0.0)
     descoberto_antigo = max(-saldo_anterior, 0.0)
 
-    abertas = []
+    abertas = deque()
     for l in linhas:
-        if l['tipo'] == 'devolucao':
+        tipo = l['tipo']
+        if tipo == 'devolucao':
             # Dinheiro que voltou. Se casou com um pagamento (valor exato), o
             # livre daquele pagamento já foi zerado — aqui não faz nada. Sem
             # par, sai do caixa; o que o caixa não cobrir vira descoberto.
@@ -1151,7 +1482,7 @@ def _aloca_fifo(linhas, saldo_anterior):
                 caixa -= tira
                 descoberto_antigo += l['valor'] - tira
             continue
-        if l['tipo'] == 'pagamento':
+        if tipo == 'pagamento':
             # Só a parte LIVRE do pagamento entra no rateio automático: o que
             # já foi amarrado à mão tem dono — e o que foi devolvido, também.
             caixa += max(l['valor'] - l.get('usado', 0.0)
@@ -1160,13 +1491,14 @@ def _aloca_fifo(linhas, saldo_anterior):
             usa = min(caixa, descoberto_antigo)
             caixa -= usa
             descoberto_antigo -= usa
-            for n in abertas:
-                if caixa <= 0.005:
-                    break
+            while abertas and caixa > 0.005:
+                n = abertas[0]
                 usa = min(caixa, n['falta'])
                 n['falta'] -= usa
                 caixa -= usa
-            abertas = [n for n in abertas if n['falta'] > 0.005]
+                if n['falta'] > 0.005:
+                    break                 # caixa acabou nesta nota
+                abertas.popleft()
         else:
             # A nota já entra abatida do que foi vinculado à mão e do
             # que foi quitado antes do corte.
@@ -1392,11 +1724,7 @@ def conf_fornecedores_dfe():
             fornecedor_ids = sorted({str(canonico.get(int(i), int(i)))
                                      for i in fornecedor_ids})
 
-        notas_ant = _notas_anteriores(conn, data_ini, empresa_ids, fornecedor_ids)
-        pagos_ant = _pagamentos_anteriores(conn, data_ini, empresa_ids, fornecedor_ids)
-        for fid, v in _devolucoes_anteriores(conn, data_ini, empresa_ids,
-                                             fornecedor_ids).items():
-            pagos_ant[fid] = pagos_ant.get(fid, 0.0) - v
+        notas_ant, pagos_ant = _saldos_anteriores(conn, data_ini, empresa_ids, fornecedor_ids)
         notas = _notas_periodo(conn, data_ini, data_fim, empresa_ids, fornecedor_ids)
         pagamentos = _pagamentos_periodo(conn, data_ini, data_fim, empresa_ids, fornecedor_ids)
         devolucoes = _devolucoes_periodo(conn, data_ini, data_fim, empresa_ids, fornecedor_ids)
@@ -1508,7 +1836,7 @@ def candidatos(doc_id):
                AND m.forn_id = %s
              ORDER BY ABS(DATEDIFF(bt.data_transacao, %s)), bt.data_transacao DESC
              LIMIT 40
-        """.replace('__MAPA__', _MAPA).replace('__RAIZ_FP__', _raiz_de('fp')),
+        """.replace('__MAPA__', _mapa()).replace('__RAIZ_FP__', _raiz_de('fp')),
             (canonico, nota['dh_emissao']))
         pagos = cur.fetchall()
         cur.close()
@@ -1567,7 +1895,7 @@ def notas_candidatas(tx_id):
               JOIN fornecedores fp ON fp.id = bt.fornecedor_id
               JOIN __MAPA__ ON m.raiz = __RAIZ_FP__
              WHERE bt.id = %s AND bt.tipo = 'DEBIT'
-        """.replace('__MAPA__', _MAPA).replace('__RAIZ_FP__', _raiz_de('fp')),
+        """.replace('__MAPA__', _mapa()).replace('__RAIZ_FP__', _raiz_de('fp')),
             (tx_id,))
         pg = cur.fetchone()
         if not pg:
@@ -1589,7 +1917,7 @@ def notas_candidatas(tx_id):
                AND m.forn_id = %s
              ORDER BY ABS(DATEDIFF(d.dh_emissao, %s)), d.dh_emissao DESC
              LIMIT 80
-        """.replace('__MAPA__', _MAPA),
+        """.replace('__MAPA__', _mapa()),
             (pg['canonico'], pg['data_transacao']))
         docs = cur.fetchall()
         cur.close()
@@ -1672,7 +2000,7 @@ def vincular_lote():
                   JOIN fornecedores fp ON fp.id = bt.fornecedor_id
                   JOIN __MAPA__ ON m.raiz = __RAIZ_FP__
                  WHERE bt.id = %s AND bt.tipo = 'DEBIT'
-            """.replace('__MAPA__', _MAPA).replace('__RAIZ_FP__', _raiz_de('fp')),
+            """.replace('__MAPA__', _mapa()).replace('__RAIZ_FP__', _raiz_de('fp')),
                 (it['doc_id'], it['transacao_id']))
             pg = cur.fetchone()
             if not pg:
@@ -1761,7 +2089,7 @@ def vincular():
               JOIN fornecedores fp ON fp.id = bt.fornecedor_id
               JOIN __MAPA__ ON m.raiz = __RAIZ_FP__
              WHERE bt.id = %s AND bt.tipo = 'DEBIT'
-        """.replace('__MAPA__', _MAPA).replace('__RAIZ_FP__', _raiz_de('fp')),
+        """.replace('__MAPA__', _mapa()).replace('__RAIZ_FP__', _raiz_de('fp')),
             (doc_id, tx_id))
         pg = cur.fetchone()
         if not pg:
@@ -1894,8 +2222,7 @@ def lancamentos_candidatos(doc_id):
         cur.execute("""
             SELECT ld.id, ld.data, ld.valor, ld.fornecedor, ld.observacao,
                    ld.bank_transaction_id, t.nome AS titulo, bt.descricao AS extrato,
-                   (LEFT(LPAD(REPLACE(REPLACE(REPLACE(bt.cnpj_cpf,'.',''),'/',''),
-                              '-',''),14,'0'),8) = %s) AS mesmo_cnpj
+                   (LEFT(LPAD(__BT__,14,'0'),8) = %s) AS mesmo_cnpj
               FROM lancamentos_despesas ld
               LEFT JOIN titulos_despesas t ON t.id = ld.titulo_id
               LEFT JOIN bank_transactions bt ON bt.id = ld.bank_transaction_id
@@ -1906,8 +2233,9 @@ def lancamentos_candidatos(doc_id):
                                   AND v.documento_id = %s)
              ORDER BY mesmo_cnpj DESC, ABS(DATEDIFF(ld.data, %s)), ld.id DESC
              LIMIT 60
-        """, (nota['raiz'], _dia(nota['dh_emissao']), _dia(nota['dh_emissao']),
-              doc_id, _dia(nota['dh_emissao'])))
+        """.replace('__BT__', digitos('bank_transactions', 'bt', 'cnpj_cpf')),
+            (nota['raiz'], _dia(nota['dh_emissao']), _dia(nota['dh_emissao']),
+             doc_id, _dia(nota['dh_emissao'])))
         cands = cur.fetchall()
         cur.close()
     finally:
@@ -2161,9 +2489,9 @@ def importar_nota():
         cur.execute("""
             SELECT id, COALESCE(nome_fantasia, razao_social) AS nome
               FROM clientes
-             WHERE REPLACE(REPLACE(REPLACE(cnpj,'.',''),'/',''),'-','') = %s
+             WHERE %s = %%s
              LIMIT 1
-        """, (nota.get('dest_cnpj') or '',))
+        """ % digitos('clientes'), (nota.get('dest_cnpj') or '',))
         emp = cur.fetchone()
         if not emp:
             cur.close()
@@ -2228,7 +2556,7 @@ def importar_nota():
 def _raizes_do_fornecedor(conn, fid):
     """Raiz do cadastro + as raízes que ele já titulariza (se for um grupo)."""
     cur = conn.cursor()
-    cur.execute("SELECT %s FROM fornecedores f WHERE f.id = %%s" % _RAIZ_FORN,
+    cur.execute("SELECT %s FROM fornecedores f WHERE f.id = %%s" % _raiz_de('f'),
                 (fid,))
     row = cur.fetchone()
     raizes = {row[0]} if row and row[0] else set()
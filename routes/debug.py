@@ -1,6 +1,7 @@
-from flask import Blueprint, render_template, jsonify, current_app
+from flask import Blueprint, render_template, jsonify, current_app, request
 from flask_login import login_required
-from utils.db import get_db_connection
+from utils.db import get_db_connection, pool_metrics, log_pool_metrics, reset_pool_metrics
+from utils.decorators import admin_required
 
 bp = Blueprint('debug', __name__, url_prefix='/debug')
 
@@ -54,3 +55,22 @@ def index():
     conn.close()
     
     return jsonify(result)
+
+
+@bp.route('/db-pool')
+@login_required
+@admin_required
+def db_pool():
+    """
+    Métricas do pool MySQL deste worker (checkouts, espera, tempo de posse,
+    fallbacks para conexão direta e endpoints que mais seguram conexão).
+    Cada worker do gunicorn tem o seu pool: some os números de cada pid para
+    dimensionar DB_POOL_SIZE. ?reset=1 zera os contadores após a leitura;
+    ?log=1 também grava o resumo no log.
+    """
+    metricas = pool_metrics(top=request.args.get('top', 10, type=int))
+    if request.args.get('log') == '1':
+        log_pool_metrics()
+    if request.args.get('reset') == '1':
+        reset_pool_metrics()
+    return jsonify(metricas)
@@ -28,6 +28,7 @@ from flask_login import login_required, current_user
 
 from routes.auth import admin_required
 from utils.db import get_db_connection
+from utils.schema_registry import garantia
 
 bp = Blueprint('depositos', __name__, url_prefix='/depositos')
 
@@ -56,6 +57,7 @@ _MATCH_WINDOW_DAYS = 5
 # DB migration
 # ──────────────────────────────────────────────────────────────────────────────
 
+@garantia
 def _ensure_deposito_bank_vinculos_table(conn):
     """
     Cria a tabela deposito_bank_vinculos que suporta vincular UM depósito a
@@ -81,9 +83,10 @@ def _ensure_deposito_bank_vinculos_table(conn):
         conn.commit()
         cur.close()
     except Exception:
-        pass  # Não crítico
+        return False  # não crítico; tenta de novo na próxima chamada
 
 
+@garantia
 def _ensure_bank_tx_col(conn):
     """
     Adiciona bank_transaction_id à lancamentos_caixa_comprovacao se ainda não
@@ -108,7 +111,7 @@ def _ensure_bank_tx_col(conn):
             conn.commit()
         cur.close()
     except Exception:
-        pass  # Não crítico
+        return False  # não crítico; tenta de novo na próxima chamada
 
 
 def _reset_orphaned_deposit_transactions(conn):
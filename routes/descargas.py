@@ -12,6 +12,7 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash,
 from flask_login import login_required
 from datetime import datetime, date
 from utils.db import get_db_connection
+from utils.schema_registry import garantia
 
 _log = logging.getLogger(__name__)
 
@@ -64,6 +65,7 @@ TABELA_VOLUMETRICA_15M3 = {
 }
 
 
+@garantia
 def _ensure_descargas_tables():
     """Cria as tabelas de descargas se ainda não existirem e aplica migrations (idempotente)."""
     ddl = """
@@ -180,10 +182,7 @@ def _ensure_descargas_tables():
         _log.warning(
             "Falha ao criar/migrar tabela descargas (não crítico).", exc_info=True
         )
-
-
-# Executar migration na importação do módulo
-_ensure_descargas_tables()
+        return False
 
 # Janela de dias para exibição de fretes no módulo de descargas
 FRETES_WINDOW_DAYS = 5
@@ -4,8 +4,10 @@ import mysql.connector
 
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from flask_login import login_required, current_user
+from utils import contas_contabeis
 from utils.db import get_db_connection
 from utils.decorators import admin_required
+from utils.schema_registry import garantia
 
 bp = Blueprint('despesas', __name__, url_prefix='/despesas')
 
@@ -15,6 +17,7 @@ _MYSQL_ERR_DUPLICATE_COLUMN = 1060  # "Duplicate column name '…'"
 _tables_ready = False
 
 
+@garantia
 def _ensure_tables():
     """Garante que a tabela categoria_despesa_contas existe. Idempotente."""
     global _tables_ready
@@ -57,6 +60,7 @@ def _ensure_tables():
             conn.rollback()
         except Exception:
             pass
+        return False
     finally:
         cursor.close()
         conn.close()
@@ -378,6 +382,7 @@ def nova_categoria():
                            ON DUPLICATE KEY UPDATE conta_contabil_id = VALUES(conta_contabil_id)""",
                         (nova_id, int(eid), conta_id)
                     )
+            contas_contabeis.invalidar(cursor)
             conn.commit()
 
             flash('Categoria criada com sucesso!', 'success')
@@ -450,6 +455,7 @@ def editar_categoria(id):
                            ON DUPLICATE KEY UPDATE conta_contabil_id = VALUES(conta_contabil_id)""",
                         (id, int(eid), conta_id)
                     )
+            contas_contabeis.invalidar(cursor)
             conn.commit()
 
             cursor.execute("SELECT titulo_id FROM categorias_despesas WHERE id = %s", (id,))
@@ -20,7 +20,7 @@ SQL 100% parametrizado (%s). NAO altera nada existente.
 from datetime import date, timedelta
 
 from flask import Blueprint, render_template, request, jsonify, current_app
-from flask_login import login_required
+from flask_login import current_user, login_required
 
 from utils.db import get_db_connection
 
@@ -952,17 +952,18 @@ def classificar():
 
 
 # ==========================================================================
-# ACAO: disparar UMA captura de DFe AGORA (botao "Capturar agora"). Roda em
-# background (thread), retorna na hora. Respeita a cota: o proprio job usa
-# GET_LOCK global (nao roda 2x) e pre-checa proximo_permitido (nao consulta a
-# SEFAZ se a cota ainda esta fechada por 656). Reaproveita disparar_captura_async
-# do agendador -> nenhuma logica de captura nova.
+# ACAO: pedir UMA captura de DFe AGORA (botao "Capturar agora"). Enfileira o
+# job 'dfe_captura' para o processo do agendador (integrations/agendador.py) e
+# retorna na hora -- o worker web nao roda captura. Respeita a cota: o proprio
+# job usa GET_LOCK global (nao roda 2x) e pre-checa proximo_permitido (nao
+# consulta a SEFAZ se a cota ainda esta fechada por 656).
 # ==========================================================================
 @dfe_compras_bp.route('/capturar-agora', methods=['POST'])
 @login_required
 def capturar_agora():
     # 1) Le o estado atual da cota (best-effort) so para dar feedback na tela.
     estado = {}
+    vivo = True
     conn = get_db_connection()
     cur = conn.cursor(dictionary=True)
     try:
@@ -976,29 +977,41 @@ def capturar_agora():
         pass
     finally:
         cur.close()
-        conn.close()
 
-    # 2) Dispara em background. O job se autoprotege (lock + proximo_permitido),
-    #    entao disparar mesmo "bloqueado" e inofensivo (ele so pula).
+    # 2) Enfileira para o processo do agendador. O job se autoprotege (lock +
+    #    proximo_permitido), entao pedir mesmo "bloqueado" e inofensivo (ele so
+    #    pula); pedido repetido enquanto o anterior espera nao duplica.
     try:
-        from integrations.dfe_scheduler import disparar_captura_async
-        disparar_captura_async(current_app._get_current_object())
+        from integrations import agendador
+        agendador.enfileirar('dfe_captura', conn=conn,
+                             pedido_por=getattr(current_user, 'username', None))
+        cur = conn.cursor()
+        try:
+            vivo = agendador.processo_vivo(cur)
+        finally:
+            cur.close()
     except Exception as e:
-        current_app.logger.exception("[dfe] falha ao disparar captura manual")
-        return jsonify({'ok': False, 'erro': 'não foi possível iniciar a captura: %s' % e}), 500
+        current_app.logger.exception("[dfe] falha ao enfileirar captura manual")
+        return jsonify({'ok': False, 'erro': 'não foi possível pedir a captura: %s' % e}), 500
+    finally:
+        conn.close()
 
     bloqueado = bool(estado.get('bloqueado'))
-    if bloqueado:
+    if not vivo:
+        mensagem = ('Captura pedida, mas o processo do agendador não está respondendo; '
+                    'ela roda assim que ele voltar.')
+    elif bloqueado:
         mensagem = ('A SEFAZ pediu para aguardar até %s (cota/656). A captura não vai '
                     'consultar agora; o agendador tenta de novo automaticamente.'
                     % estado.get('proximo_permitido'))
     else:
-        mensagem = ('Captura iniciada em segundo plano. Aguarde ~1–2 min — a página '
+        mensagem = ('Captura pedida ao agendador. Aguarde ~1–2 min — a página '
                     'recarrega sozinha para mostrar as notas novas.')
 
     return jsonify({
         'ok': True,
         'bloqueado': bloqueado,
+        'agendador_no_ar': vivo,
         'mensagem': mensagem,
         'proximo_permitido': str(estado.get('proximo_permitido') or ''),
         'ult_status': estado.get('ult_status'),
@@ -15,16 +15,24 @@ Terreno para as PROXIMAS camadas (ainda NAO implementadas aqui):
     "Inserir/editar estoque manual". A regra de negocio e que toda descarga
     acabe vinculada a uma nota de compra (por e-mail ou manual).
 """
+import json
 import math
+import os
 import re
+import threading
+import time
 import unicodedata
 from datetime import date, datetime, timedelta
 from urllib.parse import urlencode
 
-from flask import Blueprint, current_app, jsonify, render_template, request
+from flask import (Blueprint, Response, current_app, jsonify, render_template, request,
+                   stream_with_context)
 from flask_login import current_user, login_required
 
+from utils.cnpj_digitos import digitos
 from utils.fuso import BRASILIA, hoje_brasilia
+from utils.periodo_sql import intervalo_periodo
+from utils.saldo_tempo_real import CICLO_SEG as SALDO_CICLO_SEG, SALDO, notificar as notificar_saldo
 
 from integrations.descarga_vinculo import (calcular_estado, listar_vinculos,
                                            registrar_vinculo, remover_vinculo,
@@ -572,6 +580,7 @@ def descarga_manual():
              litros, chave, motivo[:255], getattr(current_user, 'id', None)),
         )
         conn.commit()
+        notificar_saldo()
         return jsonify({'ok': True, 'id': cur.lastrowid,
                         'mensagem': 'Descarga manual de %s L lançada.' % litros})
     except Exception as e:
@@ -641,6 +650,7 @@ def corrigir_volumes(descarga_id):
             ' WHERE id=%s',
             (vi, vf, total, t20, descricao, descarga_id))
         conn.commit()
+        notificar_saldo(semear=True)
         return jsonify({'ok': True, 'total': total})
     except Exception as e:
         conn.rollback()
@@ -683,6 +693,7 @@ def excluir_descarga(descarga_id):
         cur.execute("DELETE FROM descargas_pendentes WHERE id = %s AND origem = 'manual'",
                     (descarga_id,))
         conn.commit()
+        notificar_saldo(semear=True)
         current_app.logger.info('[estoque] descarga manual %s (%s L) excluida por user %s',
                                  descarga_id, d.get('total_descarga'),
                                  getattr(current_user, 'id', None))
@@ -797,8 +808,8 @@ def _auditoria_dados(cur, cliente_id, d_ini, d_fim):
         FROM leitura_tanque_diaria l
         WHERE UPPER(TRIM(l.titulo)) = 'ABERTURA'
           AND l.cliente_id = %s AND l.produto_id IN ({ids_in})
-          AND DATE(l.data_leitura) BETWEEN %s AND %s
-        GROUP BY dia, pid""", (cliente_id, d_ini, d_fim_leitura))
+          AND l.data_leitura >= %s AND l.data_leitura < %s
+        GROUP BY dia, pid""", (cliente_id, *intervalo_periodo(d_ini, d_fim_leitura)))
     leit = {(r['dia'], r['pid']): float(r['litros'] or 0) for r in cur.fetchall()}
 
     # -- vendas (mesma ponte por CNPJ da conciliacao) ---------------------
@@ -808,12 +819,11 @@ def _auditoria_dados(cur, cliente_id, d_ini, d_fim):
         FROM vendas_xml_itens i
         JOIN vendas_xml v ON v.id = i.venda_id
         JOIN clientes cl
-          ON REPLACE(REPLACE(REPLACE(REPLACE(cl.cnpj, '.', ''), '/', ''), '-', ''), ' ', '')
-             = v.cnpj_emitente
+          ON {digitos('clientes', 'cl')} = v.cnpj_emitente
         WHERE cl.id = %s AND i.produto_id IN ({ids_in})
           AND i.unidade = 'L' AND v.situacao <> 'cancelada'
-          AND DATE(v.dh_emissao) BETWEEN %s AND %s
-        GROUP BY dia, pid""", (cliente_id, d_ini, d_fim))
+          AND v.dh_emissao >= %s AND v.dh_emissao < %s
+        GROUP BY dia, pid""", (cliente_id, *intervalo_periodo(d_ini, d_fim)))
     ven = {(r['dia'], r['pid']): float(r['litros'] or 0) for r in cur.fetchall()}
 
     # -- linha N: vinculos, com a alocacao "a nota manda" -----------------
@@ -858,9 +868,9 @@ def _auditoria_dados(cur, cliente_id, d_ini, d_fim):
                d.produto_id AS pid, SUM(d.total_descarga) AS litros
         FROM descargas_pendentes d
         WHERE d.cliente_id = %s AND d.produto_id IN ({ids_in})
-          AND DATE(COALESCE(d.data_descarga, d.data_final, d.data_inicial))
-              BETWEEN %s AND %s
-        GROUP BY dia, pid""", (cliente_id, d_ini, d_fim))
+          AND COALESCE(d.data_descarga, d.data_final, d.data_inicial) >= %s
+          AND COALESCE(d.data_descarga, d.data_final, d.data_inicial) < %s
+        GROUP BY dia, pid""", (cliente_id, *intervalo_periodo(d_ini, d_fim)))
     desc = {(r['dia'], r['pid']): float(r['litros'] or 0) for r in cur.fetchall()}
 
     # -- montagem ---------------------------------------------------------
@@ -1056,9 +1066,9 @@ def conciliacao():
             FROM leitura_tanque_diaria l
             WHERE UPPER(TRIM(l.titulo)) = 'ABERTURA'
               AND l.produto_id IN ({ids_in})
-              AND DATE(l.data_leitura) BETWEEN %s AND %s
+              AND l.data_leitura >= %s AND l.data_leitura < %s
         """
-        p_ini = [data_ini, data_fim_leitura]
+        p_ini = list(intervalo_periodo(data_ini, data_fim_leitura))
         if f['empresa']:
             sql_ini += " AND l.cliente_id = %s"; p_ini.append(f['empresa'])
         if pid_filtro:
@@ -1077,14 +1087,13 @@ def conciliacao():
             FROM vendas_xml_itens i
             JOIN vendas_xml v ON v.id = i.venda_id
             JOIN clientes cl
-              ON REPLACE(REPLACE(REPLACE(REPLACE(cl.cnpj, '.', ''), '/', ''), '-', ''), ' ', '')
-                 = v.cnpj_emitente
+              ON {digitos('clientes', 'cl')} = v.cnpj_emitente
             WHERE i.produto_id IN ({ids_in})
               AND i.unidade = 'L'
               AND v.situacao <> 'cancelada'
-              AND DATE(v.dh_emissao) BETWEEN %s AND %s
+              AND v.dh_emissao >= %s AND v.dh_emissao < %s
         """
-        p_ven = [data_ini, data_fim]
+        p_ven = list(intervalo_periodo(data_ini, data_fim))
         if f['empresa']:
             sql_ven += " AND cl.id = %s"; p_ven.append(f['empresa'])
         if pid_filtro:
@@ -1104,9 +1113,9 @@ def conciliacao():
             WHERE d.tipo = 'NFe' AND d.situacao = 'autorizado'
               AND (i.categoria IS NULL OR i.categoria <> 'ignorar')
               AND COALESCE(i.classificado_produto_id, i.produto_id) IN ({ids_in})
-              AND DATE(d.dh_emissao) BETWEEN %s AND %s
+              AND d.dh_emissao >= %s AND d.dh_emissao < %s
         """
-        p_rn = [data_ini, data_fim]
+        p_rn = list(intervalo_periodo(data_ini, data_fim))
         if f['empresa']:
             sql_rn += " AND d.cliente_id = %s"; p_rn.append(f['empresa'])
         if pid_filtro:
@@ -1124,10 +1133,10 @@ def conciliacao():
                    d.produto_id AS pid, SUM(d.total_descarga) AS litros
             FROM descargas_pendentes d
             WHERE d.produto_id IN ({ids_in})
-              AND DATE(COALESCE(d.data_descarga, d.data_final, d.data_inicial))
-                  BETWEEN %s AND %s
+              AND COALESCE(d.data_descarga, d.data_final, d.data_inicial) >= %s
+              AND COALESCE(d.data_descarga, d.data_final, d.data_inicial) < %s
         """
-        p_rd = [data_ini, data_fim]
+        p_rd = list(intervalo_periodo(data_ini, data_fim))
         if f['empresa']:
             sql_rd += " AND d.cliente_id = %s"; p_rd.append(f['empresa'])
         if pid_filtro:
@@ -1280,60 +1289,36 @@ def descargas_reler():
 def dados_tempo_real(cur, cliente_id=1):
     """Saldo agora (aproximado) dos 4 combustiveis de UMA empresa, hoje.
     Retorna lista ORDENADA (Gasolina, Etanol, S-500, S-10) com nome/cor/abriu/
-    rec/ven/saldo. saldo=None quando nao ha leitura de ABERTURA hoje."""
-    hoje_s = hoje_brasilia().strftime('%Y-%m-%d')
-    ids_in = ",".join(str(i) for i in CONC_IDS)
-
-    cur.execute(
-        f"""SELECT produto_id AS pid, SUM(volume_atual) AS litros
-            FROM leitura_tanque_diaria
-            WHERE UPPER(TRIM(titulo)) = 'ABERTURA' AND produto_id IN ({ids_in})
-              AND DATE(data_leitura) = %s AND cliente_id = %s
-            GROUP BY produto_id""",
-        (hoje_s, cliente_id),
-    )
-    abertura = {r['pid']: float(r['litros'] or 0) for r in cur.fetchall()}
-
-    cur.execute(
-        f"""SELECT produto_id AS pid, SUM(total_descarga) AS litros
-            FROM descargas_pendentes
-            WHERE produto_id IN ({ids_in})
-              AND DATE(COALESCE(data_descarga, data_final, data_inicial)) = %s
-              AND cliente_id = %s
-            GROUP BY produto_id""",
-        (hoje_s, cliente_id),
-    )
-    recebido = {r['pid']: float(r['litros'] or 0) for r in cur.fetchall()}
-
-    cur.execute(
-        f"""SELECT i.produto_id AS pid, SUM(i.quantidade) AS litros
-            FROM vendas_xml_itens i
-            JOIN vendas_xml v ON v.id = i.venda_id
-            JOIN clientes cl
-              ON REPLACE(REPLACE(REPLACE(REPLACE(cl.cnpj, '.', ''), '/', ''), '-', ''), ' ', '')
-                 = v.cnpj_emitente
-            WHERE i.produto_id IN ({ids_in}) AND i.unidade = 'L'
-              AND v.situacao <> 'cancelada'
-              AND DATE(v.dh_emissao) = %s AND cl.id = %s
-            GROUP BY i.produto_id""",
-        (hoje_s, cliente_id),
-    )
-    vendas = {r['pid']: float(r['litros'] or 0) for r in cur.fetchall()}
+    rec/ven/saldo. saldo=None quando nao ha leitura de ABERTURA hoje.
+    Le o saldo em memoria (utils/saldo_tempo_real); o cursor so e usado se a
+    semente/incremento estiver vencida."""
+    SALDO.atualizar(cur, hoje_brasilia(), CONC_IDS)
+    _versao, linhas = SALDO.cards(cliente_id)
+    por_pid = {c['pid']: c for c in linhas}
 
     out = []
     for pid, info in sorted(CONC_PRODUTOS.items(), key=lambda kv: kv[1]['ordem']):
-        tem_ab = pid in abertura
-        ab = abertura.get(pid)
-        rec = recebido.get(pid, 0.0)
-        ven = vendas.get(pid, 0.0)
+        c = por_pid.get(pid) or {'abriu': None, 'rec': 0.0, 'ven': 0.0, 'saldo': None}
         out.append({
             'pid': pid, 'nome': info['nome'], 'cor': info['cor'],
-            'abriu': ab, 'rec': rec, 'ven': ven,
-            'saldo': (ab + rec - ven) if tem_ab else None,
+            'abriu': c['abriu'], 'rec': c['rec'], 'ven': c['ven'], 'saldo': c['saldo'],
         })
     return out
 
 
+def _card_tempo_real(c, nome_emp):
+    """Linha de SALDO.cards() -> card da tela (nome/cor do produto + empresa)."""
+    info = CONC_PRODUTOS[c['pid']]
+    return {
+        'cliente_id': c['cliente_id'],
+        'empresa_nome': nome_emp.get(c['cliente_id'], '—'),
+        'pid': c['pid'], 'nome': info['nome'], 'cor': info['cor'],
+        'cbg': info['cbg'], 'ordem': info['ordem'],
+        'tanques': c['tanques'], 'abriu': c['abriu'],
+        'rec': c['rec'], 'ven': c['ven'], 'saldo': c['saldo'],
+    }
+
+
 # ==========================================================================
 # ESTOQUE EM TEMPO REAL (saldo APROXIMADO de HOJE, por produto/empresa).
 #   Saldo agora = Abertura de hoje + Recebido hoje (descarga/e-mail) - Vendas hoje
@@ -1346,7 +1331,6 @@ def dados_tempo_real(cur, cliente_id=1):
 def tempo_real():
     empresa = (request.args.get('empresa') or '').strip()
     hoje = hoje_brasilia()
-    hoje_s = hoje.strftime('%Y-%m-%d')
     agora_hm = datetime.now(BRASILIA).strftime('%H:%M')
 
     conn = get_db_connection()
@@ -1365,83 +1349,17 @@ def tempo_real():
         empresas = cur.fetchall()
         nome_emp = {e['id']: e['nome'] for e in empresas}
 
-        ids_in = ",".join(str(i) for i in CONC_IDS)
-
-        # ---- 1) ABERTURA de hoje ----
-        sql_ab = f"""
-            SELECT l.cliente_id, l.produto_id AS pid, SUM(l.volume_atual) AS litros,
-                   GROUP_CONCAT(DISTINCT l.tanque ORDER BY l.tanque) AS tanques
-            FROM leitura_tanque_diaria l
-            WHERE UPPER(TRIM(l.titulo)) = 'ABERTURA'
-              AND l.produto_id IN ({ids_in})
-              AND DATE(l.data_leitura) = %s
-        """
-        p_ab = [hoje_s]
-        if empresa:
-            sql_ab += " AND l.cliente_id = %s"; p_ab.append(empresa)
-        sql_ab += " GROUP BY l.cliente_id, pid"
-        cur.execute(sql_ab, p_ab)
-        abertura = {(r['cliente_id'], r['pid']): {'litros': float(r['litros'] or 0),
-                                                  'tanques': r['tanques']}
-                    for r in cur.fetchall()}
-
-        # ---- 2) RECEBIDO hoje (descarga do e-mail) ----
-        sql_rec = f"""
-            SELECT d.cliente_id, d.produto_id AS pid, SUM(d.total_descarga) AS litros
-            FROM descargas_pendentes d
-            WHERE d.produto_id IN ({ids_in})
-              AND DATE(COALESCE(d.data_descarga, d.data_final, d.data_inicial)) = %s
-        """
-        p_rec = [hoje_s]
-        if empresa:
-            sql_rec += " AND d.cliente_id = %s"; p_rec.append(empresa)
-        sql_rec += " GROUP BY d.cliente_id, pid"
-        cur.execute(sql_rec, p_rec)
-        recebido = {(r['cliente_id'], r['pid']): float(r['litros'] or 0)
-                    for r in cur.fetchall()}
-
-        # ---- 3) VENDAS hoje (produto ja resolvido; ponte cnpj -> cliente_id) ----
-        sql_ven = f"""
-            SELECT cl.id AS cliente_id, i.produto_id AS pid, SUM(i.quantidade) AS litros
-            FROM vendas_xml_itens i
-            JOIN vendas_xml v ON v.id = i.venda_id
-            JOIN clientes cl
-              ON REPLACE(REPLACE(REPLACE(REPLACE(cl.cnpj, '.', ''), '/', ''), '-', ''), ' ', '')
-                 = v.cnpj_emitente
-            WHERE i.produto_id IN ({ids_in})
-              AND i.unidade = 'L'
-              AND v.situacao <> 'cancelada'
-              AND DATE(v.dh_emissao) = %s
-        """
-        p_ven = [hoje_s]
-        if empresa:
-            sql_ven += " AND cl.id = %s"; p_ven.append(empresa)
-        sql_ven += " GROUP BY cl.id, pid"
-        cur.execute(sql_ven, p_ven)
-        vendas = {(r['cliente_id'], r['pid']): float(r['litros'] or 0)
-                  for r in cur.fetchall()}
+        # ---- Abertura + Recebido - Vendas: saldo em memoria (semente 1x/dia,
+        #      depois so as linhas novas) -- ver utils/saldo_tempo_real ----
+        SALDO.atualizar(cur, hoje, CONC_IDS)
+        if empresa and not empresa.isdigit():
+            linhas = []
+        else:
+            _versao, linhas = SALDO.cards(int(empresa) if empresa else None)
 
         # ---- MONTAGEM: um card por (empresa, produto) com qualquer sinal hoje ----
-        chaves = set(abertura) | set(recebido) | set(vendas)
-        cards = []
-        for (cid, pid) in chaves:
-            info = CONC_PRODUTOS.get(pid)
-            if not info:
-                continue
-            ab = abertura.get((cid, pid))
-            rec = recebido.get((cid, pid), 0.0)
-            ven = vendas.get((cid, pid), 0.0)
-            tem_ab = ab is not None
-            saldo = (ab['litros'] + rec - ven) if tem_ab else None
-            cards.append({
-                'cliente_id': cid,
-                'empresa_nome': nome_emp.get(cid, '—'),
-                'pid': pid, 'nome': info['nome'], 'cor': info['cor'],
-                'cbg': info['cbg'], 'ordem': info['ordem'],
-                'tanques': ab['tanques'] if tem_ab else None,
-                'abriu': ab['litros'] if tem_ab else None,
-                'rec': rec, 'ven': ven, 'saldo': saldo,
-            })
+        cards = [_card_tempo_real(c, nome_emp) for c in linhas
+                 if c['pid'] in CONC_PRODUTOS]
         cards.sort(key=lambda c: (c['empresa_nome'], c['ordem']))
 
         return render_template(
@@ -1449,13 +1367,83 @@ def tempo_real():
             cards=cards, empresas=empresas, empresa=empresa,
             um_empresa=bool(empresa),
             empresa_nome=(nome_emp.get(int(empresa)) if empresa.isdigit() else None),
-            agora_hm=agora_hm,
+            agora_hm=agora_hm, dia=hoje.isoformat(),
         )
     finally:
         cur.close()
         conn.close()
 
 
+# ==========================================================================
+# STREAM (SSE) do saldo em tempo real: a tela e o card da home assinam e
+# recebem so as linhas que mudaram, em vez de recarregar. Cada stream ocupa
+# uma thread do worker (gunicorn gthread, ver start.sh), entao ha um teto
+# por processo e o stream fecha sozinho depois de TR_STREAM_MAX_SEG (o
+# EventSource reconecta e recebe a foto inteira de novo).
+#   data: {"dia": "YYYY-MM-DD", "versao": N, "cards": [ {cliente_id, pid,
+#          abriu, rec, ven, saldo, tanques}, ... ]}
+# ==========================================================================
+TR_MAX_STREAMS = int(os.environ.get('ESTOQUE_TR_MAX_STREAMS', 4))
+TR_STREAM_MAX_SEG = int(os.environ.get('ESTOQUE_TR_STREAM_MAX_SEG', 10 * 60))
+_tr_streams = threading.BoundedSemaphore(TR_MAX_STREAMS)
+
+
+def _atualizar_saldo():
+    """Atualiza SALDO com conexao propria, so se estiver vencido/avisado."""
+    hoje = hoje_brasilia()
+    if not SALDO.precisa_atualizar(hoje):
+        return
+    conn = get_db_connection()
+    cur = conn.cursor(dictionary=True)
+    try:
+        SALDO.atualizar(cur, hoje, CONC_IDS)
+    finally:
+        cur.close()
+        conn.close()
+
+
+@estoque_bp.route('/estoque/tempo-real/stream', methods=['GET'])
+@login_required
+def tempo_real_stream():
+    cliente_id = request.args.get('empresa', type=int)
+
+    def gerar():
+        # O teto e pego DENTRO do gerador: se o cliente cair antes do primeiro
+        # byte, o finally nao roda e a vaga vazaria.
+        if not _tr_streams.acquire(blocking=False):
+            # Teto de streams do processo: o navegador cai no recarregar periodico.
+            yield 'event: cheio\ndata: {}\n\n'
+            return
+        # A primeira mensagem e SEMPRE a foto inteira (desde=0): a versao e
+        # por processo e a pagina pode ter sido montada pelo outro worker.
+        desde, primeira = 0, True
+        try:
+            yield 'retry: %d\n\n' % int(SALDO_CICLO_SEG * 1000)
+            fim = time.monotonic() + TR_STREAM_MAX_SEG
+            while time.monotonic() < fim:
+                try:
+                    _atualizar_saldo()
+                except Exception:
+                    current_app.logger.warning('[estoque] stream: atualizar saldo falhou',
+                                               exc_info=True)
+                    time.sleep(SALDO_CICLO_SEG)
+                versao, linhas = SALDO.cards(cliente_id, desde)
+                if linhas or primeira:
+                    yield 'data: %s\n\n' % json.dumps(
+                        {'dia': SALDO.dia.isoformat() if SALDO.dia else None,
+                         'versao': versao, 'cards': linhas})
+                    primeira = False
+                else:
+                    yield ': ping\n\n'   # mantem a conexao e detecta aba fechada
+                desde = versao
+                SALDO.esperar(desde, SALDO_CICLO_SEG)
+        finally:
+            _tr_streams.release()
+
+    return Response(stream_with_context(gerar()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
 # ==========================================================================
 # PENDENTE PRA DESCER: notas que compraram combustivel mas nao desceram tudo.
 #   saldo = dfe_itens.quantidade - SUM(descarga_nota.litros do item)
@@ -1504,7 +1492,7 @@ def pendente_descer():
                          FROM descarga_nota GROUP BY item_id) v
                    ON v.item_id = i.id
             WHERE doc.tipo = 'NFe' AND doc.situacao = 'autorizado'
-              AND DATE(doc.dh_emissao) >= %s
+              AND doc.dh_emissao >= %s
               AND COALESCE(i.classificado_produto_id, i.produto_id) IN ({ids_in})
               AND (i.categoria IS NULL OR i.categoria <> 'ignorar')
               AND NOT EXISTS (SELECT 1 FROM descarga_nota f
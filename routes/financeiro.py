@@ -1,9 +1,10 @@
 from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for, current_app, Response, stream_with_context, send_file, abort
 from flask_login import login_required, current_user
 from utils.decorators import admin_required
-from utils.db import get_db_connection
+from utils.db import get_db_connection, get_request_connection
 from utils.navegacao import destino_pos_acao
 from utils.boletos import emitir_boleto_frete, emitir_boleto_multiplo, fetch_charge, fetch_boleto_pdf_stream, update_billet_expire, cancel_charge, _get_bearer_token, _ensure_credentials_from_env
+from utils import boleto_cache
 from datetime import datetime, date, timedelta
 from calendar import monthrange
 from urllib.parse import quote
@@ -591,6 +592,23 @@ def _wants_json():
     return request.headers.get('X-Requested-With') == 'XMLHttpRequest' or request.accept_mimetypes.accept_json
 
 
+def _prefetch_pdf(resultado):
+    """Boleto emitido: já coloca o PDF no cache local (utils/boleto_cache), em
+    segundo plano, para a primeira visualização não ir ao provedor."""
+    if isinstance(resultado, dict) and resultado.get("success"):
+        boleto_cache.prefetch(_get_efi_credentials(), resultado.get("charge_id"),
+                              resultado.get("pdf_boleto"))
+    return resultado
+
+
+def _enviar_pdf(entrada, download_name, as_attachment):
+    """PDF do cache com ETag do conteúdo: repetição do navegador vira 304."""
+    resp = send_file(entrada.caminho, mimetype='application/pdf', as_attachment=as_attachment,
+                     download_name=download_name, etag=entrada.etag, conditional=True)
+    resp.cache_control.private = True
+    return resp
+
+
 @financeiro_bp.route('/emitir-boleto/<int:frete_id>/', methods=['POST'])
 @login_required
 def emitir_boleto_route(frete_id):
@@ -606,7 +624,7 @@ def emitir_boleto_route(frete_id):
         else:
             vencimento = request.form.get('vencimento') or request.form.get('new_vencimento') or None
 
-        resultado = emitir_boleto_frete(frete_id, vencimento_str=vencimento)
+        resultado = _prefetch_pdf(emitir_boleto_frete(frete_id, vencimento_str=vencimento))
         if not isinstance(resultado, dict):
             msg = "Erro inesperado ao emitir boleto: resposta inválida"
             current_app.logger.error(f"[emitir_boleto] resposta inválida: {repr(resultado)}")
@@ -671,7 +689,7 @@ def emitir_boleto_multiple_route():
         if not isinstance(frete_ids, (list, tuple)) or len(frete_ids) == 0:
             return jsonify({"success": False, "error": "frete_ids ausentes ou inválidos"}), 400
 
-        resultado = emitir_boleto_multiplo(frete_ids, vencimento_str=vencimento)
+        resultado = _prefetch_pdf(emitir_boleto_multiplo(frete_ids, vencimento_str=vencimento))
         if not isinstance(resultado, dict):
             current_app.logger.error("emitir_boleto_multiple_route: resposta inválida")
             return jsonify({"success": False, "error": "Resposta inválida do utilitário"}), 500
@@ -720,6 +738,7 @@ def prorrogar_boleto(charge_id):
         if not success:
             current_app.logger.warning("[prorrogar_boleto] falha provedor: %r", resp)
             return jsonify({"success": False, "error": resp}), 400
+        boleto_cache.invalidar(charge_id)   # PDF com o vencimento velho
 
         # atualizar localmente data_vencimento se houver registro
         try:
@@ -777,7 +796,7 @@ def reemitir_boleto(charge_id):
                 fid = int(override_frete_id)
                 cur.close()
                 conn.close()
-                resultado = emitir_boleto_frete(fid)
+                resultado = _prefetch_pdf(emitir_boleto_frete(fid))
                 return jsonify(resultado), (200 if resultado.get("success") else 400)
             except Exception:
                 pass
@@ -787,7 +806,7 @@ def reemitir_boleto(charge_id):
                 fid = int(cobr.get("frete_id"))
                 cur.close()
                 conn.close()
-                resultado = emitir_boleto_frete(fid)
+                resultado = _prefetch_pdf(emitir_boleto_frete(fid))
                 return jsonify(resultado), (200 if resultado.get("success") else 400)
             except Exception:
                 pass
@@ -800,7 +819,7 @@ def reemitir_boleto(charge_id):
             cur.close()
             conn.close()
             if frete_ids:
-                resultado = emitir_boleto_multiplo(frete_ids)
+                resultado = _prefetch_pdf(emitir_boleto_multiplo(frete_ids))
                 return jsonify(resultado), (200 if resultado.get("success") else 400)
         except Exception:
             # tentar com nome alternativo da tabela se usar outro nome
@@ -811,7 +830,7 @@ def reemitir_boleto(charge_id):
                 cur.close()
                 conn.close()
                 if frete_ids:
-                    resultado = emitir_boleto_multiplo(frete_ids)
+                    resultado = _prefetch_pdf(emitir_boleto_multiplo(frete_ids))
                     return jsonify(resultado), (200 if resultado.get("success") else 400)
             except Exception:
                 current_app.logger.debug("reemitir_boleto: cobrancas_freites não existe ou falhou a query")
@@ -921,8 +940,10 @@ def visualizar_boleto(charge_id):
     """
     Primeiro tenta servir PDF salvo localmente (pdf_boleto em cobrancas).
     - se pdf_boleto for um caminho local existente -> serve com send_file inline
-    - se pdf_boleto for uma URL -> redireciona para a URL (abrir no provedor)
-    Se não houver pdf_boleto ou estiver inválido, faz fetch ao provedor e stream (com fetch_boleto_pdf_stream).
+    - se pdf_boleto for uma URL -> serve do cache local (utils/boleto_cache),
+      baixando na primeira vez; sem cache, redireciona para a URL
+    Se não houver pdf_boleto ou estiver inválido, usa o cache ou faz fetch ao
+    provedor (fetch_boleto_pdf_stream) e guarda no cache.
     """
     try:
         row = None
@@ -959,9 +980,15 @@ def visualizar_boleto(charge_id):
                 else:
                     try:
                         if pdf_boleto.startswith('http://') or pdf_boleto.startswith('https://'):
+                            entrada = boleto_cache.buscar(_get_efi_credentials(), charge_id, pdf_boleto)
+                            if entrada:
+                                return _enviar_pdf(entrada, f"boleto_{charge_id}.pdf", False)
                             return redirect(pdf_boleto)
                     except Exception:
                         pass
+            entrada = boleto_cache.obter(charge_id)
+            if entrada:
+                return _enviar_pdf(entrada, f"boleto_{charge_id}.pdf", False)
             if link_boleto and isinstance(link_boleto, str) and (link_boleto.startswith('http://') or link_boleto.startswith('https://')):
                 return redirect(link_boleto)
 
@@ -977,6 +1004,13 @@ def visualizar_boleto(charge_id):
             flash("URL do PDF não encontrada na resposta do provedor.", "danger")
             return redirect(url_for('financeiro.recebimentos'))
 
+        if boleto_cache.disponivel():
+            entrada = boleto_cache.buscar(credentials, charge_id, pdf_url)
+            if not entrada:
+                flash("Falha ao buscar PDF do provedor.", "danger")
+                return redirect(url_for('financeiro.recebimentos'))
+            return _enviar_pdf(entrada, f"boleto_{charge_id}.pdf", False)
+
         resp = fetch_boleto_pdf_stream(credentials, pdf_url)
         if not resp or getattr(resp, "status_code", None) != 200:
             text = getattr(resp, "text", "") if isinstance(resp, dict) else (getattr(resp, "text", "") or "")
@@ -1036,7 +1070,13 @@ def download_boleto(charge_id):
 
         link = (pdf_boleto if (pdf_boleto and isinstance(pdf_boleto, str) and pdf_boleto.startswith('http'))
                 else row.get("link_boleto"))
+        entrada = (boleto_cache.buscar(_get_efi_credentials(), charge_id, link) if link
+                   else boleto_cache.obter(charge_id))
+        if entrada:
+            return _enviar_pdf(entrada, filename, True)
         if link:
+            # Sem cache, ou o cache não guardou (disco, provedor, não-PDF):
+            # o proxy direto de antes.
             credentials = _get_efi_credentials()
             stream_resp = fetch_boleto_pdf_stream(credentials, link)
             if stream_resp and getattr(stream_resp, "status_code", None) == 200:
@@ -1079,6 +1119,7 @@ def alterar_vencimento(charge_id):
         if not success:
             flash(f"Falha ao atualizar vencimento no provedor: {resp}", "danger")
             return redirect(url_for('financeiro.recebimentos'))
+        boleto_cache.invalidar(charge_id)   # PDF com o vencimento velho
 
         conn = conn or get_db_connection()
         cursor = cursor or conn.cursor(dictionary=True)
@@ -2398,7 +2439,9 @@ def _get_bank_transactions(tipo, request_args, exclude_transfers=False):
     'TRANSFER_<id>' ou pela coluna tipo_conciliacao='transferencia'.
     """
     from datetime import date
-    conn = get_db_connection()
+    # Conexão da request: recebimento/pagamentos reaproveitam a mesma conexão
+    # nas consultas seguintes em vez de fazer um segundo checkout no pool.
+    conn = get_request_connection()
     cursor = conn.cursor(dictionary=True)
 
     # Suporte a multi-select: getlist retorna lista; get retorna string única.
@@ -2687,7 +2730,7 @@ def pagamentos():
     filtro_aplicado = bool(empresa_ids_filter or conta_ids_filter)
 
     # Busca categorias de despesas para o filtro (com nome do título para contexto)
-    conn = get_db_connection()
+    conn = get_request_connection()
     cursor = conn.cursor(dictionary=True)
     try:
         cursor.execute(
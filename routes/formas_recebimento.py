@@ -2,12 +2,14 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash,
 from flask_login import login_required
 from utils.db import get_db_connection
 from utils.decorators import admin_required
+from utils.schema_registry import garantia
 
 bp = Blueprint('formas_recebimento', __name__, url_prefix='/formas_recebimento')
 
 _tables_ready = False
 
 
+@garantia
 def _ensure_tables():
     """Garante que as colunas/tabelas extras de formas_recebimento existem. Idempotente."""
     global _tables_ready
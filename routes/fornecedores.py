@@ -5,14 +5,17 @@ import json as _json
 
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from flask_login import login_required
+from utils import contas_contabeis
 from utils.db import get_db_connection
 from utils.decorators import admin_required
+from utils.schema_registry import garantia
 
 bp = Blueprint('fornecedores', __name__, url_prefix='/fornecedores')
 
 _tables_ready = False
 
 
+@garantia
 def _ensure_tables():
     """Garante que a tabela fornecedor_empresas existe e que a coluna cep existe. Idempotente."""
     global _tables_ready
@@ -324,6 +327,7 @@ def novo():
                            ON DUPLICATE KEY UPDATE conta_contabil_id = VALUES(conta_contabil_id)""",
                         (novo_id, int(eid), conta_contabil_id)
                     )
+            contas_contabeis.invalidar(cursor)
             conn.commit()
 
             flash('Fornecedor cadastrado com sucesso!', 'success')
@@ -419,6 +423,7 @@ def editar(id):
                            ON DUPLICATE KEY UPDATE conta_contabil_id = VALUES(conta_contabil_id)""",
                         (id, int(eid), conta_contabil_id)
                     )
+            contas_contabeis.invalidar(cursor)
             conn.commit()
 
             flash('Fornecedor atualizado com sucesso!', 'success')
@@ -460,6 +465,7 @@ def excluir(id):
         conn = get_db_connection()
         cursor = conn.cursor()
         cursor.execute("DELETE FROM fornecedores WHERE id = %s", (id,))
+        contas_contabeis.invalidar(cursor)
         conn.commit()
         flash('Fornecedor excluído com sucesso!', 'success')
     except Exception as e:
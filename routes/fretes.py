@@ -4,7 +4,9 @@ from routes.auth import admin_required
 import re
 from datetime import datetime, date
 from utils.db import get_db_connection
+from utils.dashboard_metricas import invalidar as invalidar_dashboard
 from utils.helpers import parse_moeda
+from utils.schema_registry import garantia
 
 bp = Blueprint('fretes', __name__, url_prefix='/fretes')
 
@@ -12,6 +14,7 @@ import logging as _logging
 _logger = _logging.getLogger(__name__)
 
 
+@garantia
 def _ensure_fretes_pedido_id(conn=None):
     """
     Garante que a coluna pedido_id existe na tabela fretes.
@@ -62,6 +65,7 @@ def _ensure_fretes_pedido_id(conn=None):
             except Exception:
                 pass
         _logger.warning("_ensure_fretes_pedido_id: não foi possível garantir coluna pedido_id: %s", e)
+        return False
     finally:
         if cur:
             try:
@@ -366,6 +370,7 @@ def novo():
                         int(form_id),
                     ))
                     conn.commit()
+                    invalidar_dashboard('fretes')
                     flash('Frete atualizado com sucesso!', 'success')
                     return redirect(url_for('fretes.lista'))
                 except Exception as e:
@@ -417,6 +422,7 @@ def novo():
                     lucro or 0
                 ))
                 conn.commit()
+                invalidar_dashboard('fretes')
             finally:
                 try:
                     cur.close()
@@ -709,6 +715,9 @@ def salvar_importados():
                 current_app.logger.exception("[salvar_importados] erro ao salvar item[%d]: %s", idx, e_item)
                 failed.append({'idx': idx, 'error': str(e_item), 'item': item})
         
+        if saved:
+            invalidar_dashboard('fretes')
+
         # Se todos os itens foram salvos com sucesso e temos um pedido_id, atualizar status para 'Faturado'
         current_app.logger.info("[salvar_importados] Verificando condições: saved=%d, failed=%d, pedido_id=%s", saved, len(failed), pedido_id)
         if saved > 0 and len(failed) == 0 and pedido_id:
@@ -870,6 +879,7 @@ def editar(id):
                 id,
             ))
             conn.commit()
+            invalidar_dashboard('fretes')
             flash('Frete atualizado com sucesso!', 'success')
             return redirect(session.get('fretes_lista_url') or url_for('fretes.lista'))
         except Exception as e:
@@ -1035,6 +1045,7 @@ def deletar(id):
             cursor = conn.cursor()
             cursor.execute("DELETE FROM fretes WHERE id = %s", (id,))
             conn.commit()
+            invalidar_dashboard('fretes')
             flash(f'Frete #{id} excluído.', 'success')
         except Exception as e:
             try:
@@ -5,6 +5,7 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash,
 from flask_login import login_required, current_user
 from utils.db import get_db_connection
 from utils.decorators import admin_required, supervisor_or_admin_required
+from utils.schema_registry import garantia
 from datetime import datetime, timedelta
 from decimal import Decimal
 import json
@@ -24,6 +25,7 @@ _ENUM_VAL_RE = re.compile(r'^[A-Za-z0-9_]+$')
 bp = Blueprint('lancamentos_caixa', __name__, url_prefix='/lancamentos_caixa')
 
 
+@garantia
 def _ensure_comprovacao_data_deposito(conn):
     """Adiciona coluna data_deposito à tabela lancamentos_caixa_comprovacao se ainda não existir."""
     cur = conn.cursor()
@@ -38,6 +40,7 @@ def _ensure_comprovacao_data_deposito(conn):
         cur.close()
 
 
+@garantia
 def _ensure_caixa_formas_tipos():
     """
     Garante que as linhas 'VENDA PROGRAMADA' (formas_pagamento_caixa) e
@@ -133,6 +136,7 @@ def _ensure_caixa_formas_tipos():
                 conn.rollback()
             except Exception:
                 pass
+        return False
     finally:
         if cur is not None:
             cur.close()
@@ -2,12 +2,14 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash,
 from flask_login import login_required
 from utils.db import get_db_connection
 from utils.decorators import admin_required
+from utils.schema_registry import garantia
 from datetime import datetime, timedelta
 import calendar
 
 bp = Blueprint('lancamentos_funcionarios', __name__, url_prefix='/lancamentos-funcionarios')
 
 
+@garantia(persistir=False)
 def _ensure_tipo_funcionario(conn):
     """
     Garante que a coluna tipo_funcionario existe em lancamentosfuncionarios_v2 e
@@ -29,6 +29,8 @@ from models.lucro_postos import (FifoAbertura, FifoCompetencia,
 from models.produto import Produto
 from routes.auth import admin_required
 from utils.db import get_db_connection
+from utils.dashboard_metricas import invalidar as invalidar_dashboard
+from utils.fifo import calcular as calcular_fifo
 
 logger = logging.getLogger(__name__)
 
@@ -93,86 +95,6 @@ def _produtos_do_cliente(cliente_id):
         conn.close()
 
 
-def _calcular_fifo(camadas_iniciais, compras, vendas):
-    """
-    Calcula FIFO para uma lista de camadas, compras e vendas de um produto.
-
-    camadas_iniciais: list of {'qtde': float, 'custo': float}
-    compras: list of {'data': date, 'qtde': float, 'custo': float}
-    vendas:  list of {'data': date, 'qtde': float, 'valor_total': float}
-
-    Retorna: (resultado_dict, camadas_finais)
-    """
-    layers = [{'qtde': Decimal(str(c['qtde'])), 'custo': Decimal(str(c['custo']))}
-              for c in camadas_iniciais if float(c['qtde']) > 0]
-
-    qtde_entrada = Decimal('0')
-    custo_entrada = Decimal('0')
-    qtde_saida = Decimal('0')
-    receita = Decimal('0')
-    cogs = Decimal('0')
-
-    # Agrupar por data
-    from collections import defaultdict
-    comp_by_date = defaultdict(list)
-    for c in sorted(compras, key=lambda x: x['data']):
-        comp_by_date[c['data']].append(c)
-    vend_by_date = defaultdict(list)
-    for v in sorted(vendas, key=lambda x: x['data']):
-        vend_by_date[v['data']].append(v)
-
-    all_dates = sorted(set(list(comp_by_date.keys()) + list(vend_by_date.keys())))
-
-    for data in all_dates:
-        # Processar compras (adicionar camadas, mais antigas primeiro dentro do dia)
-        for comp in comp_by_date.get(data, []):
-            qtde = Decimal(str(comp['qtde']))
-            custo = Decimal(str(comp['custo']))
-            if qtde > 0:
-                layers.append({'qtde': qtde, 'custo': custo})
-                qtde_entrada += qtde
-                custo_entrada += qtde * custo
-
-        # Processar vendas (consumir camadas FIFO)
-        for vend in vend_by_date.get(data, []):
-            qtde_vender = Decimal(str(vend['qtde']))
-            valor = Decimal(str(vend['valor_total']))
-            if qtde_vender <= 0:
-                continue
-            qtde_saida += qtde_vender
-            receita += valor
-
-            restante = qtde_vender
-            while restante > Decimal('0.001') and layers:
-                layer = layers[0]
-                if layer['qtde'] <= restante + Decimal('0.001'):
-                    cogs += layer['qtde'] * layer['custo']
-                    restante -= layer['qtde']
-                    layers.pop(0)
-                else:
-                    cogs += restante * layer['custo']
-                    layer['qtde'] -= restante
-                    restante = Decimal('0')
-
-    estoque_final_qtde = sum(l['qtde'] for l in layers)
-    estoque_final_valor = sum(l['qtde'] * l['custo'] for l in layers)
-
-    resultado = {
-        'qtde_entrada': float(qtde_entrada),
-        'custo_entrada_total': float(custo_entrada),
-        'custo_entrada_unit': float(custo_entrada / qtde_entrada) if qtde_entrada > 0 else 0.0,
-        'qtde_saida': float(qtde_saida),
-        'receita_saida': float(receita),
-        'preco_medio_saida': float(receita / qtde_saida) if qtde_saida > 0 else 0.0,
-        'cogs': float(cogs),
-        'lucro': float(receita - cogs),
-        'estoque_final_qtde': float(estoque_final_qtde),
-        'estoque_final_valor': float(estoque_final_valor),
-        'estoque_final_custo_unit': float(estoque_final_valor / estoque_final_qtde) if estoque_final_qtde > 0 else 0.0,
-    }
-    return resultado, layers
-
-
 # ---------------------------------------------------------------------------
 # Dashboard
 # ---------------------------------------------------------------------------
@@ -311,6 +233,7 @@ def abertura_salvar(cliente_id):
     else:
         try:
             db.session.commit()
+            invalidar_dashboard('fifo')
             flash(f'Abertura FIFO de {cliente.razao_social} salva com sucesso.', 'success')
         except Exception as exc:
             db.session.rollback()
@@ -396,7 +319,7 @@ def fechar():
             """, (cliente_id, pid, data_inicio, data_fim))
             vendas = cur.fetchall()
 
-            resultado, camadas = _calcular_fifo(camadas_base, compras, vendas)
+            resultado, camadas = calcular_fifo(camadas_base, compras, vendas)
             resultado_por_produto[pid] = resultado
             camadas_finais_por_produto[pid] = camadas
     finally:
@@ -466,6 +389,7 @@ def fechar():
             db.session.add(rm)
 
         db.session.commit()
+        invalidar_dashboard('fifo')
         flash(f'Mês {ano_mes} fechado com sucesso.', 'success')
     except Exception as exc:
         db.session.rollback()
@@ -501,6 +425,7 @@ def reabrir():
         comp.reaberto_em = datetime.utcnow()
         comp.reaberto_por = current_user.id
         db.session.commit()
+        invalidar_dashboard('fifo')
         flash(f'Mês {ano_mes} reaberto. Faça as correções e feche novamente.', 'success')
     except Exception as exc:
         db.session.rollback()
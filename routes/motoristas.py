@@ -3,10 +3,12 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash
 from flask_login import login_required
 from utils.db import get_db_connection
 from utils.decorators import admin_required
+from utils.schema_registry import garantia
 
 bp = Blueprint('motoristas', __name__, url_prefix='/motoristas')
 
 
+@garantia
 def _ensure_veiculo_id(conn):
     """Adiciona coluna veiculo_id à tabela motoristas se ainda não existir."""
     cur = conn.cursor()
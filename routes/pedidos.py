@@ -2,6 +2,9 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash,
 from flask_login import login_required
 from urllib.parse import urlparse
 from utils.db import get_db_connection
+from utils.periodo_sql import intervalo_periodo
+from utils.dashboard_metricas import invalidar as invalidar_dashboard
+from utils.schema_registry import garantia
 from datetime import datetime, date, timedelta
 import logging
 import time
@@ -30,6 +33,7 @@ def _safe_return_url(value):
     return None
 
 
+@garantia
 def _ensure_quantidades_extras():
     """
     Garante que as quantidades extras existam na tabela quantidades.
@@ -75,6 +79,7 @@ def _ensure_quantidades_extras():
             except Exception:
                 pass
         logger.warning("_ensure_quantidades_extras: falhou: %s", e)
+        return False
     finally:
         if cur:
             try:
@@ -160,10 +165,18 @@ def index():
         WHERE 1=1
     """
     params = []
-    
+
+    # Período como intervalo semiaberto (usa índice de data_pedido).
+    periodo = None
     if data_inicio and data_fim:
-        sql += " AND DATE(p.data_pedido) BETWEEN %s AND %s"
-        params.extend([data_inicio, data_fim])
+        try:
+            periodo = intervalo_periodo(data_inicio, data_fim)
+        except ValueError:
+            periodo = None
+    
+    if periodo:
+        sql += " AND p.data_pedido >= %s AND p.data_pedido < %s"
+        params.extend(periodo)
     
     if status:
         sql += " AND p.status = %s"
@@ -187,8 +200,8 @@ def index():
         LEFT JOIN pedidos_itens pi ON p.id = pi.pedido_id
         WHERE 1=1
     """
-    if data_inicio and data_fim:
-        sql_rv += " AND DATE(p.data_pedido) BETWEEN %s AND %s"
+    if periodo:
+        sql_rv += " AND p.data_pedido >= %s AND p.data_pedido < %s"
     if status:
         sql_rv += " AND p.status = %s"
     sql_rv += " GROUP BY p.veiculo_id, v.caminhao, v.placa ORDER BY total_quantidade DESC"
@@ -210,8 +223,8 @@ def index():
         LEFT JOIN pedidos_itens pi ON p.id = pi.pedido_id
         WHERE 1=1
     """
-    if data_inicio and data_fim:
-        sql_rvm += " AND DATE(p.data_pedido) BETWEEN %s AND %s"
+    if periodo:
+        sql_rvm += " AND p.data_pedido >= %s AND p.data_pedido < %s"
     if status:
         sql_rvm += " AND p.status = %s"
     sql_rvm += " GROUP BY p.veiculo_id, v.caminhao, v.placa, p.motorista_id, m.nome ORDER BY total_quantidade DESC"
@@ -320,6 +333,7 @@ def novo():
             conn.commit()
             cursor.close()
             conn.close()
+            invalidar_dashboard('pedidos')
             
             flash(f'Pedido {numero} criado com sucesso!', 'success')
             return redirect(url_for('pedidos.visualizar', id=pedido_id))
@@ -518,6 +532,7 @@ def editar(id):
             conn.commit()
             cursor.close()
             conn.close()
+            invalidar_dashboard('pedidos')
             
             flash('Pedido atualizado com sucesso!', 'success')
             return redirect(url_for('pedidos.visualizar', id=id, return_url=return_url))
@@ -618,6 +633,7 @@ def excluir(id):
     conn.commit()
     cursor.close()
     conn.close()
+    invalidar_dashboard('pedidos')
     flash('Pedido excluído com sucesso!', 'success')
     return redirect(url_for('pedidos.index'))
 
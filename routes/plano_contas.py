@@ -5,8 +5,10 @@ import unicodedata
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 from flask_login import login_required
 
+from utils import contas_contabeis
 from utils.db import get_db_connection
 from utils.decorators import admin_required
+from utils.schema_registry import garantia
 
 
 def _gerar_codigo(nome):
@@ -62,6 +64,7 @@ bp = Blueprint('plano_contas', __name__, url_prefix='/plano-contas')
 _tables_ready = False
 
 
+@garantia
 def _ensure_tables():
     """Garante que todas as tabelas/colunas do plano de contas existem.
 
@@ -162,6 +165,7 @@ def _ensure_tables():
             conn.rollback()
         except Exception:
             log.debug('_ensure_tables: rollback também falhou', exc_info=True)
+        return False
     finally:
         cursor.close()
         conn.close()
@@ -295,6 +299,7 @@ def excluir(id):
             "UPDATE clientes SET grupo_contabil_id = NULL WHERE grupo_contabil_id = %s", (id,)
         )
         cursor.execute("DELETE FROM plano_contas_grupos WHERE id = %s", (id,))
+        contas_contabeis.invalidar(cursor)   # as contas do grupo saem em cascata
         conn.commit()
         flash('Grupo excluído com sucesso!', 'success')
     except Exception as e:
@@ -528,6 +533,7 @@ def editar_conta(conta_id):
                    WHERE id=%s""",
                 (codigo, nome, descricao, ativo, tipo_grupo, conta_id),
             )
+            contas_contabeis.invalidar(cursor)
             conn.commit()
             flash('Conta atualizada com sucesso!', 'success')
             return redirect(url_for('plano_contas.detalhe', id=conta['grupo_id']))
@@ -564,6 +570,7 @@ def excluir_conta(conta_id):
     cursor = conn.cursor()
     try:
         cursor.execute("DELETE FROM plano_contas_contas WHERE id = %s", (conta_id,))
+        contas_contabeis.invalidar(cursor)
         conn.commit()
         flash('Conta excluída com sucesso!', 'success')
     except Exception as e:
@@ -6,6 +6,7 @@ from flask import Blueprint, render_template, request, flash, redirect, url_for,
 from flask_login import login_required, current_user
 from models import db, Cliente, Produto, ClienteProduto
 from datetime import datetime, timedelta
+from utils.dashboard_metricas import invalidar as invalidar_dashboard
 
 # Criar blueprint do posto
 posto_bp = Blueprint('posto', __name__, url_prefix='/posto')
@@ -379,6 +380,7 @@ def vendas_lancar():
                 return redirect(url_for('posto.vendas_lancar'))
             
             db.session.commit()
+            invalidar_dashboard('vendas_posto')
             
             flash(f'✅ {vendas_criadas} venda(s) lançada(s) com sucesso!', 'success')
             return redirect(url_for('posto.vendas_lista'))
@@ -513,6 +515,7 @@ def vendas_editar_data(data, cliente_id):
                 return redirect(url_for('posto.vendas_editar_data', data=data, cliente_id=cliente_id))
             
             db.session.commit()
+            invalidar_dashboard('vendas_posto')
             flash(f'✅ {vendas_atualizadas} venda(s) atualizada(s) com sucesso!', 'success')
             return redirect(session.get('posto_vendas_lista_url') or url_for('posto.vendas_lista'))
         
@@ -585,6 +588,7 @@ def vendas_deletar(venda_id):
         
         db.session.delete(venda)
         db.session.commit()
+        invalidar_dashboard('vendas_posto')
         
         flash('✅ Venda deletada com sucesso!', 'success')
     
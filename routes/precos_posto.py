@@ -10,6 +10,7 @@ from flask import Blueprint, render_template, request, flash, redirect, url_for,
 from flask_login import login_required
 from routes.auth import admin_required
 from utils.db import get_db_connection
+from utils.schema_registry import garantia
 import logging
 
 bp = Blueprint('precos_posto', __name__, url_prefix='/precos')
@@ -38,6 +39,7 @@ def _abrev_produto(nome):
     return nome
 
 
+@garantia
 def _ensure_tables():
     global _tables_ready
     if _tables_ready:
@@ -98,6 +100,7 @@ def _ensure_tables():
     except Exception:
         logger.exception("precos_posto: _ensure_tables falhou")
         conn.rollback()
+        return False
     finally:
         conn.close()
 
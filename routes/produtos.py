@@ -2,12 +2,14 @@ from datetime import date
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 from flask_login import login_required
 from utils.db import get_db_connection
+from utils.schema_registry import garantia
 
 bp = Blueprint('produtos', __name__, url_prefix='/produtos')
 
 _tables_ready = False
 
 
+@garantia
 def _ensure_tables():
     """Creates produto_empresas table and conta_contabil_id column if not present. Idempotent."""
     global _tables_ready
@@ -1,10 +1,13 @@
 from flask import Blueprint, render_template, request, redirect, url_for, Response, jsonify
 from flask_login import login_required
 from utils.db import get_db_connection
+from utils.fifo import FilaFifo, avancar as avancar_fifo, calcular as calcular_fifo
+from utils.schema_registry import garantia
 from datetime import datetime, date
 import calendar
 import csv
 import io
+import json
 import logging
 
 from routes.auth import admin_required
@@ -522,79 +525,6 @@ def fretes_produtos():
 # Relatório: Lucro Postos (FIFO)
 # ---------------------------------------------------------------------------
 
-def _calcular_fifo_relatorio(camadas_iniciais, compras, vendas):
-    """
-    Calcula FIFO para um produto. Reutiliza a mesma lógica das rotas admin.
-    Retorna (resultado_dict, camadas_finais_list).
-    """
-    from decimal import Decimal
-    from collections import defaultdict
-
-    layers = [{'qtde': Decimal(str(c['qtde'])), 'custo': Decimal(str(c['custo']))}
-              for c in camadas_iniciais if float(c.get('qtde', 0)) > 0]
-
-    qtde_entrada = Decimal('0')
-    custo_entrada = Decimal('0')
-    qtde_saida = Decimal('0')
-    receita = Decimal('0')
-    cogs = Decimal('0')
-
-    comp_by_date = defaultdict(list)
-    for c in sorted(compras, key=lambda x: x['data']):
-        comp_by_date[c['data']].append(c)
-    vend_by_date = defaultdict(list)
-    for v in sorted(vendas, key=lambda x: x['data']):
-        vend_by_date[v['data']].append(v)
-
-    all_dates = sorted(set(list(comp_by_date.keys()) + list(vend_by_date.keys())))
-
-    for data in all_dates:
-        for comp in comp_by_date.get(data, []):
-            qtde = Decimal(str(comp['qtde']))
-            custo = Decimal(str(comp['custo']))
-            if qtde > 0:
-                layers.append({'qtde': qtde, 'custo': custo})
-                qtde_entrada += qtde
-                custo_entrada += qtde * custo
-
-        for vend in vend_by_date.get(data, []):
-            qtde_vender = Decimal(str(vend['qtde']))
-            valor = Decimal(str(vend['valor_total']))
-            if qtde_vender <= 0:
-                continue
-            qtde_saida += qtde_vender
-            receita += valor
-            restante = qtde_vender
-            while restante > Decimal('0.001') and layers:
-                layer = layers[0]
-                if layer['qtde'] <= restante + Decimal('0.001'):
-                    cogs += layer['qtde'] * layer['custo']
-                    restante -= layer['qtde']
-                    layers.pop(0)
-                else:
-                    cogs += restante * layer['custo']
-                    layer['qtde'] -= restante
-                    restante = Decimal('0')
-
-    estoque_final_qtde = sum(l['qtde'] for l in layers)
-    estoque_final_valor = sum(l['qtde'] * l['custo'] for l in layers)
-
-    resultado = {
-        'qtde_entrada': float(qtde_entrada),
-        'custo_entrada_total': float(custo_entrada),
-        'custo_entrada_unit': float(custo_entrada / qtde_entrada) if qtde_entrada > 0 else 0.0,
-        'qtde_saida': float(qtde_saida),
-        'receita_saida': float(receita),
-        'preco_medio_saida': float(receita / qtde_saida) if qtde_saida > 0 else 0.0,
-        'cogs': float(cogs),
-        'lucro': float(receita - cogs),
-        'estoque_final_qtde': float(estoque_final_qtde),
-        'estoque_final_valor': float(estoque_final_valor),
-        'estoque_final_custo_unit': float(estoque_final_valor / estoque_final_qtde) if estoque_final_qtde > 0 else 0.0,
-    }
-    return resultado, layers
-
-
 def _obter_camadas_base_relatorio(cur, cliente_id, produto_id, ano, mes):
     """Obtém camadas base para o relatório FIFO (snapshot anterior ou abertura)."""
     if mes == 1:
@@ -637,12 +567,16 @@ def _obter_camadas_base_relatorio(cur, cliente_id, produto_id, ano, mes):
     return []
 
 
-def _calcular_resultado_cliente(cur, cliente_id, ano_mes, data_inicio, data_fim, produto_ids_filtro=None):
+def _calcular_resultado_cliente(cur, cliente_id, ano_mes, data_inicio, data_fim, produto_ids_filtro=None,
+                                pendentes=None):
     """
     Retorna resultados por produto para um cliente num mês.
     Se mês FECHADO: usa fifo_resumo_mensal.
     Se ABERTO: calcula on-the-fly.
+    `pendentes`: checkpoints FIFO do request (ver _advance_layers_com_checkpoint).
     """
+    if pendentes is None:
+        pendentes = {}
     ano, mes = int(ano_mes[:4]), int(ano_mes[5:7])
 
     # Verificar status da competência
@@ -727,11 +661,8 @@ def _calcular_resultado_cliente(cur, cliente_id, ano_mes, data_inicio, data_fim,
             pid = prod['id']
             camadas_base = _obter_camadas_base_relatorio(cur, cliente_id, pid, ano, mes)
 
-            # Converter para lista mutável de floats para eventuais avanços
-            _layers_b = [
-                {'qtde': float(l.get('qtde', 0)), 'custo': float(l.get('custo', 0))}
-                for l in camadas_base if float(l.get('qtde', 0)) > 0
-            ]
+            # Fila FIFO em float para eventuais avanços
+            _layers_b = FilaFifo(camadas_base)
 
             # Quando o mês anterior não está fechado, as camadas vêm de fifo_abertura
             # (estoque de abertura, ex.: 01/01). É preciso avançar pelas transações
@@ -749,11 +680,12 @@ def _calcular_resultado_cliente(cur, cliente_id, ano_mes, data_inicio, data_fim,
                         _ab_date_b = datetime.strptime(_ab_date_b, '%Y-%m-%d').date()
                     _mes_ini_b = date(ano, mes, 1)
                     if _ab_date_b < _mes_ini_b:
-                        _advance_layers_to_date(cur, cliente_id, pid, _layers_b, _ab_date_b, _mes_ini_b)
+                        _advance_layers_com_checkpoint(cur, cliente_id, pid, _layers_b, _ab_date_b, _mes_ini_b,
+                                                       pendentes)
 
             # EI: peso das camadas FIFO no início do mês (já avançadas)
-            ei_qtde = sum(l['qtde'] for l in _layers_b)
-            ei_valor = sum(l['qtde'] * l['custo'] for l in _layers_b)
+            ei_qtde = _layers_b.qtde_total()
+            ei_valor = _layers_b.valor_total()
 
             cur.execute("""
                 SELECT f.data_frete AS data,
@@ -782,10 +714,10 @@ def _calcular_resultado_cliente(cur, cliente_id, ano_mes, data_inicio, data_fim,
             """, (cliente_id, pid, data_inicio, data_fim))
             vendas = cur.fetchall()
 
-            resultado, _ = _calcular_fifo_relatorio(_layers_b, compras, vendas)
+            resultado, _ = calcular_fifo(_layers_b.camadas(), compras, vendas)
             resultado['estoque_inicial_qtde'] = ei_qtde
             resultado['estoque_inicial_valor'] = ei_valor
-            resultado['estoque_inicial_custo_unit'] = float(_layers_b[0]['custo']) if _layers_b else 0.0
+            resultado['estoque_inicial_custo_unit'] = float(_layers_b.custo_frente())
             resultado['status'] = 'ABERTO'
             resultados[pid] = resultado
 
@@ -812,36 +744,14 @@ def _meses_no_intervalo(data_inicio, data_fim):
     return meses
 
 
-def _consumir_fifo(layers, quantidade):
-    """
-    Consome `quantidade` litros das camadas FIFO (mais antigas primeiro).
-    Modifica `layers` in-place.
-    Retorna o COGS (custo total) das unidades consumidas.
-    """
-    cogs = 0.0
-    restante = quantidade
-    while restante > 0.001 and layers:
-        camada = layers[0]
-        if camada['qtde'] <= restante + 0.001:
-            cogs += camada['qtde'] * camada['custo']
-            restante -= camada['qtde']
-            layers.pop(0)
-        else:
-            cogs += restante * camada['custo']
-            camada['qtde'] -= restante
-            restante = 0.0
-    return cogs
-
-
 def _advance_layers_to_date(cur, cliente_id, pid, layers, from_date, to_date):
     """
     Avança as camadas FIFO de from_date até to_date (exclusive),
     processando compras e vendas em ordem cronológica dia a dia.
     Usado quando as camadas vêm de fifo_abertura e é preciso reflectir
     todas as transações dos meses anteriores ainda não fechados.
-    Modifica `layers` in-place.
+    `layers` é uma FilaFifo (float), modificada in-place.
     """
-    from collections import defaultdict as _dd
     if from_date >= to_date:
         return
 
@@ -856,11 +766,7 @@ def _advance_layers_to_date(cur, cliente_id, pid, layers, from_date, to_date):
           AND COALESCE(f.quantidade_manual, q.valor, 0) > 0
         ORDER BY f.data_frete
     """, (cliente_id, pid, from_date, to_date))
-    compras_by_date = _dd(list)
-    for row in cur.fetchall():
-        compras_by_date[row['data']].append(
-            {'qtde': float(row['qtde']), 'custo': float(row['custo'])}
-        )
+    compras = cur.fetchall()
 
     cur.execute("""
         SELECT data_movimento AS data,
@@ -873,22 +779,145 @@ def _advance_layers_to_date(cur, cliente_id, pid, layers, from_date, to_date):
     """, (cliente_id, pid, from_date, to_date))
     vendas_by_date = {row['data']: float(row['qtde'] or 0) for row in cur.fetchall()}
 
-    all_dates = sorted(set(list(compras_by_date.keys()) + list(vendas_by_date.keys())))
-    for d in all_dates:
-        for comp in compras_by_date.get(d, []):
-            if comp['qtde'] > 0 and comp['custo'] > 0:
-                layers.append({'qtde': comp['qtde'], 'custo': comp['custo']})
-        qtde_v = vendas_by_date.get(d, 0.0)
-        if qtde_v > 0:
-            _consumir_fifo(layers, qtde_v)
+    avancar_fifo(layers, compras, vendas_by_date)
+
+
+def _ler_checkpoint_fifo(cur, cliente_id, pid, depois_de, ate):
+    """
+    Checkpoint mais recente em fifo_checkpoint_diario com depois_de < data <= ate.
+    Retorna (data, camadas) ou None. Falha de leitura (tabela ausente etc.)
+    equivale a "sem checkpoint" — o chamador refaz o replay completo.
+    """
+    try:
+        cur.execute("""
+            SELECT data, camadas FROM fifo_checkpoint_diario
+            WHERE cliente_id = %s AND produto_id = %s
+              AND data > %s AND data <= %s
+            ORDER BY data DESC
+            LIMIT 1
+        """, (cliente_id, pid, depois_de, ate))
+        row = cur.fetchone()
+    except Exception:
+        logger.warning("Falha ao ler fifo_checkpoint_diario (cliente=%s, produto=%s)",
+                       cliente_id, pid, exc_info=True)
+        return None
+    if not row:
+        return None
+    data_ck = row['data']
+    if isinstance(data_ck, str):
+        data_ck = datetime.strptime(data_ck, '%Y-%m-%d').date()
+    camadas = [{'qtde': q, 'custo': c} for q, c in json.loads(row['camadas'])]
+    return data_ck, camadas
+
+
+def _versao_checkpoint_fifo(cur, cliente_id, pid):
+    """Versão atual de fifo_checkpoint_versao (0 se nunca houve movimento)."""
+    try:
+        cur.execute("""
+            SELECT versao FROM fifo_checkpoint_versao
+            WHERE cliente_id = %s AND produto_id = %s
+        """, (cliente_id, pid))
+        row = cur.fetchone()
+    except Exception:
+        logger.warning("Falha ao ler fifo_checkpoint_versao (cliente=%s, produto=%s)",
+                       cliente_id, pid, exc_info=True)
+        return None
+    return row['versao'] if row else 0
+
+
+def _gravar_checkpoints_fifo(conn, cur, pendentes):
+    """
+    Grava os checkpoints calculados no request, um cliente+produto por vez.
+
+    O trigger que invalida checkpoints sobe fifo_checkpoint_versao antes do
+    DELETE. Um movimento gravado depois da leitura da versão (e portanto
+    possivelmente fora do replay) deixa a versão diferente: os checkpoints
+    desse cliente+produto são descartados em vez de sobreviver ao DELETE.
+    O SELECT ... FOR UPDATE segura o trigger concorrente até o commit.
+    """
+    for (cliente_id, pid), pend in pendentes.items():
+        if not pend['camadas'] or pend['versao'] is None:
+            continue
+        try:
+            cur.execute("""
+                INSERT IGNORE INTO fifo_checkpoint_versao (cliente_id, produto_id, versao)
+                VALUES (%s, %s, 0)
+            """, (cliente_id, pid))
+            cur.execute("""
+                SELECT versao FROM fifo_checkpoint_versao
+                WHERE cliente_id = %s AND produto_id = %s
+                FOR UPDATE
+            """, (cliente_id, pid))
+            if cur.fetchone()['versao'] != pend['versao']:
+                conn.rollback()
+                continue
+            cur.executemany("""
+                INSERT INTO fifo_checkpoint_diario (cliente_id, produto_id, data, camadas)
+                VALUES (%s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE camadas = VALUES(camadas), criado_em = CURRENT_TIMESTAMP
+            """, [(cliente_id, pid, data_ck, json.dumps(camadas))
+                  for data_ck, camadas in sorted(pend['camadas'].items())])
+            conn.commit()
+        except Exception:
+            logger.warning("Falha ao gravar fifo_checkpoint_diario (cliente=%s, produto=%s)",
+                           cliente_id, pid, exc_info=True)
+            try:
+                conn.rollback()
+            except Exception:
+                pass
 
 
-def _calcular_diario_cliente(cur, cliente_id, data_inicio, data_fim, produto_ids_filtro=None):
+def _advance_layers_com_checkpoint(cur, cliente_id, pid, layers, from_date, to_date, pendentes):
+    """
+    Igual a _advance_layers_to_date, mas retoma do checkpoint válido mais
+    próximo de to_date e anota checkpoints no 1º dia de cada mês percorrido.
+
+    `layers` deve ser o estado em from_date (abertura). Os checkpoints são
+    invalidados por trigger quando fretes/vendas_posto mudam numa data anterior
+    a eles, e o replay mês a mês aplica os movimentos na mesma ordem do avanço
+    de uma vez só — o resultado é idêntico ao replay completo.
+    Modifica `layers` in-place. Os checkpoints novos ficam em `pendentes`
+    ({(cliente, produto): {'versao', 'camadas': {data: [[qtde, custo], ...]}}})
+    — servem às chamadas seguintes do mesmo request e são gravados por
+    _gravar_checkpoints_fifo, contra a versão lida aqui antes do replay.
+    """
+    if from_date >= to_date:
+        return
+
+    pend = pendentes.get((cliente_id, pid))
+    if pend is None:
+        pend = pendentes[(cliente_id, pid)] = {
+            'versao': _versao_checkpoint_fifo(cur, cliente_id, pid),
+            'camadas': {},
+        }
+
+    ck = _ler_checkpoint_fifo(cur, cliente_id, pid, from_date, to_date)
+    locais = [d for d in pend['camadas'] if from_date < d <= to_date]
+    if locais and (not ck or max(locais) > ck[0]):
+        d = max(locais)
+        ck = d, [{'qtde': q, 'custo': c} for q, c in pend['camadas'][d]]
+    if ck:
+        inicio, camadas = ck
+        layers.redefinir(camadas)
+    else:
+        inicio = from_date
+
+    d = inicio
+    while d < to_date:
+        prox = date(d.year + 1, 1, 1) if d.month == 12 else date(d.year, d.month + 1, 1)
+        prox = min(prox, to_date)
+        _advance_layers_to_date(cur, cliente_id, pid, layers, d, prox)
+        pend['camadas'][prox] = [[l['qtde'], l['custo']] for l in layers.camadas()]
+        d = prox
+
+
+def _calcular_diario_cliente(cur, cliente_id, data_inicio, data_fim, produto_ids_filtro=None,
+                             pendentes=None):
     """
     Retorna dados dia a dia de estoque para um cliente no intervalo de datas.
 
     Usa FIFO verdadeiro: o custo só muda quando um lote anterior é esgotado.
-    layers = fila FIFO de {'qtde': float, 'custo': float}.
+    layers = FilaFifo (utils/fifo.py) em float.
 
     Resultado: {produto_id: {
         'nome': str,
@@ -904,9 +933,13 @@ def _calcular_diario_cliente(cur, cliente_id, data_inicio, data_fim, produto_ids
             'lucro_diario', 'lucro_acumulado'
         }]
     }}
+    `pendentes`: checkpoints FIFO do request (ver _advance_layers_com_checkpoint).
     """
     import calendar as _cal
 
+    if pendentes is None:
+        pendentes = {}
+
     cur.execute("""
         SELECT DISTINCT p.id, p.nome
         FROM produto p
@@ -923,13 +956,9 @@ def _calcular_diario_cliente(cur, cliente_id, data_inicio, data_fim, produto_ids
         pid = prod['id']
 
         # ── Inicializar camadas FIFO ao início do mês de data_inicio ─────────
-        layers = _obter_camadas_base_relatorio(
+        layers = FilaFifo(_obter_camadas_base_relatorio(
             cur, cliente_id, pid, data_inicio.year, data_inicio.month
-        )
-        layers = [
-            {'qtde': float(l.get('qtde', 0)), 'custo': float(l.get('custo', 0))}
-            for l in layers if float(l.get('qtde', 0)) > 0
-        ]
+        ))
 
         mes_inicio = date(data_inicio.year, data_inicio.month, 1)
 
@@ -955,7 +984,8 @@ def _calcular_diario_cliente(cur, cliente_id, data_inicio, data_fim, produto_ids
                 if isinstance(_ab_date_d, str):
                     _ab_date_d = datetime.strptime(_ab_date_d, '%Y-%m-%d').date()
                 if _ab_date_d < mes_inicio:
-                    _advance_layers_to_date(cur, cliente_id, pid, layers, _ab_date_d, mes_inicio)
+                    _advance_layers_com_checkpoint(cur, cliente_id, pid, layers, _ab_date_d, mes_inicio,
+                                                   pendentes)
 
         # Se data_inicio não é o 1º do mês, avançar layers até data_inicio
         if data_inicio > mes_inicio:
@@ -973,7 +1003,7 @@ def _calcular_diario_cliente(cur, cliente_id, data_inicio, data_fim, produto_ids
             """, (cliente_id, pid, mes_inicio, data_inicio))
             for row in cur.fetchall():
                 if float(row['qtde']) > 0:
-                    layers.append({'qtde': float(row['qtde']), 'custo': float(row['custo'])})
+                    layers.entrada(float(row['qtde']), float(row['custo']))
             # Vendas entre 1º do mês e data_inicio (exclusive)
             cur.execute("""
                 SELECT SUM(COALESCE(quantidade_litros, 0)) AS qtde
@@ -984,12 +1014,12 @@ def _calcular_diario_cliente(cur, cliente_id, data_inicio, data_fim, produto_ids
             row = cur.fetchone()
             vendas_pre = float(row['qtde'] or 0) if row else 0.0
             if vendas_pre > 0:
-                _consumir_fifo(layers, vendas_pre)
+                layers.consumir(vendas_pre)
 
         # EI do período = estado das camadas agora
-        ei_mes_custo_unit = layers[0]['custo'] if layers else 0.0
-        ei_mes_valor = sum(l['qtde'] * l['custo'] for l in layers)
-        ei_mes_fifo_qtde = sum(l['qtde'] for l in layers)
+        ei_mes_custo_unit = layers.custo_frente()
+        ei_mes_valor = layers.valor_total()
+        ei_mes_fifo_qtde = layers.qtde_total()
 
         # ── Vendas diárias ────────────────────────────────────────────────────
         cur.execute("""
@@ -1059,20 +1089,20 @@ def _calcular_diario_cliente(cur, cliente_id, data_inicio, data_fim, produto_ids
             custo_medio_compra = float(c.get('custo_medio_compra') or 0)
 
             # Valor FIFO do estoque inicial do dia
-            ei_valor = sum(l['qtde'] * l['custo'] for l in layers)
+            ei_valor = layers.valor_total()
 
             # Adicionar compra do dia ao final da fila FIFO
             if compras > 0 and custo_medio_compra > 0:
-                layers.append({'qtde': compras, 'custo': custo_medio_compra})
+                layers.entrada(compras, custo_medio_compra)
 
             # Consumir vendas pelo método FIFO (lotes mais antigos primeiro)
-            cogs_fifo = _consumir_fifo(layers, vendas)
+            cogs_fifo = layers.consumir(vendas)
 
             # Custo corrido = média ponderada FIFO do que foi vendido no dia
             custo_corrido = cogs_fifo / vendas if vendas > 0 else 0.0
 
             ef_calculado = ei + compras - vendas
-            ef_calc_valor = sum(l['qtde'] * l['custo'] for l in layers)
+            ef_calc_valor = layers.valor_total()
 
             lucro_diario = receita - cogs_fifo
             lucro_acumulado += lucro_diario
@@ -1130,8 +1160,8 @@ def _calcular_diario_cliente(cur, cliente_id, data_inicio, data_fim, produto_ids
                 break
 
         # EF FIFO: estado final das camadas após todos os dias processados
-        ef_mes_fifo_qtde = sum(l['qtde'] for l in layers)
-        ef_mes_valor = sum(l['qtde'] * l['custo'] for l in layers)
+        ef_mes_fifo_qtde = layers.qtde_total()
+        ef_mes_valor = layers.valor_total()
         ef_mes_custo_unit = ef_mes_valor / ef_mes_fifo_qtde if ef_mes_fifo_qtde else 0.0
 
         resultado[pid] = {
@@ -1155,6 +1185,7 @@ def _calcular_diario_cliente(cur, cliente_id, data_inicio, data_fim, produto_ids
 _lucro_ajuste_table_ready = False
 
 
+@garantia
 def _ensure_lucro_ajuste_table():
     """Cria tabela lucro_postos_ajuste_sobra se ainda não existir. Idempotente."""
     global _lucro_ajuste_table_ready
@@ -1184,6 +1215,7 @@ def _ensure_lucro_ajuste_table():
         _lucro_ajuste_table_ready = True
     except Exception:
         logger.warning("_ensure_lucro_ajuste_table: falha ao criar tabela", exc_info=True)
+        return False
     finally:
         if conn:
             conn.close()
@@ -1307,6 +1339,7 @@ def lucro_postos():
         if filtrou:
             prod_filtro = set(produto_ids)
             meses = _meses_no_intervalo(data_inicio, data_fim)
+            pendentes = {}
 
             for cid in cliente_ids:
                 res_total = {}
@@ -1319,7 +1352,7 @@ def lucro_postos():
                     mes_fim = date(ano_m, mes_m, calendar.monthrange(ano_m, mes_m)[1])
                     # Passa o intervalo completo do mês para manter a fidelidade FIFO
                     res, fechado = _calcular_resultado_cliente(
-                        cur, cid, ano_mes, mes_inicio, mes_fim, prod_filtro
+                        cur, cid, ano_mes, mes_inicio, mes_fim, prod_filtro, pendentes
                     )
                     ultimo_fechado = fechado
 
@@ -1362,9 +1395,12 @@ def lucro_postos():
                     }
 
                 diario_por_cliente[cid] = _calcular_diario_cliente(
-                    cur, cid, data_inicio, data_fim, prod_filtro
+                    cur, cid, data_inicio, data_fim, prod_filtro, pendentes
                 )
 
+            # Persistir os checkpoints FIFO calculados (com checagem de versão)
+            _gravar_checkpoints_fifo(conn, cur, pendentes)
+
             # Sincronizar EI e EF do resumo com os valores da tabela diária
             # EI Qtde: usa ei_mes (estoque físico medido no 1º dia do período solicitado)
             # EF Qtde: usa ef_mes (estoque real medido = ei do dia seguinte), igual ao tfoot da tabela detalhada
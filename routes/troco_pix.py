@@ -23,8 +23,10 @@ def _agora_br():
     return datetime.now(_BRASILIA)
 
 # Importar função de conexão do banco de dados
+from utils import contas_contabeis
 from utils.db import get_db_connection
 from utils.formatadores import formatar_moeda
+from utils.schema_registry import garantia
 
 # Criar blueprint
 troco_pix_bp = Blueprint('troco_pix', __name__, url_prefix='/troco_pix')
@@ -1195,6 +1197,7 @@ _logger_tp = _logging.getLogger(__name__)
 
 _troco_pix_cc_table_ready = False
 
+@garantia
 def _ensure_troco_pix_conta_contabil_table():
     """Garante que a tabela troco_pix_conta_contabil existe. Idempotente."""
     global _troco_pix_cc_table_ready
@@ -1231,6 +1234,7 @@ def _ensure_troco_pix_conta_contabil_table():
         _troco_pix_cc_table_ready = True
     except Exception:
         _logger_tp.warning("_ensure_troco_pix_conta_contabil_table: falha", exc_info=True)
+        return False
     finally:
         if conn:
             conn.close()
@@ -1269,6 +1273,7 @@ def config_contabil():
                         "DELETE FROM troco_pix_conta_contabil WHERE cliente_id = %s",
                         (cid,),
                     )
+            contas_contabeis.invalidar(cursor)
             conn.commit()
             cursor.close()
             flash('Configuração contábil salva com sucesso!', 'success')
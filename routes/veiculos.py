@@ -13,6 +13,7 @@ from werkzeug.utils import secure_filename
 
 from utils.db import get_db_connection
 from utils.decorators import admin_required
+from utils.schema_registry import garantia
 
 bp = Blueprint('veiculos', __name__, url_prefix='/veiculos')
 
@@ -40,6 +41,7 @@ def _ensure_upload_dir():
     return path
 
 
+@garantia
 def _ensure_tables():
     """Garante que as tabelas e colunas extras de veículos existem. Idempotente."""
     global _tables_ready
@@ -142,6 +144,7 @@ def _ensure_tables():
             conn.rollback()
         except Exception:
             pass
+        return False
     finally:
         cursor.close()
         conn.close()
@@ -20,6 +20,7 @@ from urllib.parse import urlencode
 from flask import Blueprint, render_template, request, abort, jsonify
 from flask_login import login_required
 
+from utils.cnpj_digitos import digitos
 from utils.db import get_db_connection
 from utils.pagamentos import classificar_recebimento
 
@@ -350,13 +351,12 @@ def classificar():
                   AND dp.cprod = i.cprod
                   AND dp.ativo = 1
             LEFT JOIN clientes cl
-                   ON REPLACE(REPLACE(REPLACE(cl.cnpj, '.', ''), '/', ''), '-', '')
-                      = v.cnpj_emitente
+                   ON %s = v.cnpj_emitente
             WHERE dp.id IS NULL
               AND i.cprod IS NOT NULL AND i.cprod <> ''
             GROUP BY v.cnpj_emitente, i.cprod
             ORDER BY litros DESC, itens DESC
-            """
+            """ % digitos('clientes', 'cl')
         )
         pendentes = cur.fetchall()
 
@@ -377,11 +377,10 @@ def classificar():
             FROM vendas_xml_depara_produto dp
             LEFT JOIN produto p ON p.id = dp.produto_id
             LEFT JOIN clientes cl
-                   ON REPLACE(REPLACE(REPLACE(cl.cnpj, '.', ''), '/', ''), '-', '')
-                      = dp.cnpj_emitente
+                   ON %s = dp.cnpj_emitente
             GROUP BY dp.id, dp.cnpj_emitente, dp.cprod, dp.produto_id, dp.ativo, p.nome
             ORDER BY emitente_nome, dp.cprod
-            """
+            """ % digitos('clientes', 'cl')
         )
         regras = cur.fetchall()
 
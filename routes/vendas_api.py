@@ -16,12 +16,15 @@ usuário logado.
 """
 import os
 import hmac
+import json
+import time
 
 from flask import Blueprint, request, current_app, jsonify
 
 from extensions import csrf
 from utils.db import get_db_connection
-from integrations.vendas_produto import aplicar_depara_venda
+from utils.saldo_tempo_real import notificar as notificar_saldo
+from integrations.vendas_produto import DeparaVenda, aplicar_depara_venda
 
 vendas_api_bp = Blueprint('vendas_api', __name__, url_prefix='')
 
@@ -99,6 +102,10 @@ _SQL_INSERT_ITEM = (
 _SQL_CANCELA = "UPDATE vendas_xml SET situacao = 'cancelada' WHERE chave = %s"
 
 
+def _valores(row):
+    return tuple(row.values()) if isinstance(row, dict) else tuple(row)
+
+
 def _autenticado():
     """
     Compara o token do header Authorization: Bearer <token> com ROBO_VENDAS_TOKEN
@@ -121,6 +128,259 @@ def _autenticado():
     return hmac.compare_digest(enviado.encode('utf-8'), esperado.encode('utf-8'))
 
 
+# Ingestão em massa: notas em lotes de VENDAS_API_LOTE por transação, com uma
+# checagem de existência por lote e executemany para cabeçalhos e itens.
+_LOTE = max(1, int(os.environ.get('VENDAS_API_LOTE', '500')))
+
+_MIMES_NDJSON = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+
+
+def _itens_da_nota(nota):
+    """Itens da nota (lista de dicts). Item que não é objeto derruba a nota."""
+    itens = nota.get('itens') or []
+    if not isinstance(itens, list):
+        itens = []
+    for item in itens:
+        if not isinstance(item, dict):
+            raise ValueError("item não é objeto JSON")
+    return itens
+
+
+def _params_cabecalho(nota):
+    return (tuple(nota.get(c) for c in _CAMPOS_CABECALHO)
+            + _com_defaults(nota, _CABECALHO_NOVOS))
+
+
+def _params_item(venda_id, item, produto_id):
+    valores = tuple(produto_id if c == 'produto_id' else item.get(c) for c in _CAMPOS_ITEM)
+    return (venda_id,) + valores + _com_defaults(item, _ITEM_NOVOS)
+
+
+def _gravar_nota(conn, cur, nota):
+    """
+    Caminho nota-a-nota (transação própria). Usado quando o lote inteiro
+    falha, para isolar a nota problemática. Retorna 'ok' ou 'repetida';
+    exceção -> a nota vai para erros (rollback feito por quem chamou).
+    """
+    chave = nota['chave']
+    cur.execute(_SQL_EXISTE, (chave,))
+    if cur.fetchone() is not None:
+        return 'repetida'
+
+    cur.execute(_SQL_INSERT_CABECALHO, _params_cabecalho(nota))
+    venda_id = cur.lastrowid
+    for item in _itens_da_nota(nota):
+        cur.execute(_SQL_INSERT_ITEM, _params_item(venda_id, item, item.get('produto_id')))
+
+    # Resolve nosso produto_id (de-para cnpj+cprod -> fallback ANP).
+    # Se o robo ja mandou produto_id, aplica so nos itens NULL.
+    # Falha aqui NAO derruba a ingestao da nota.
+    try:
+        aplicar_depara_venda(cur, venda_id)
+    except Exception as e_resolv:
+        current_app.logger.warning(
+            "[api/vendas] resolver produto_id falhou p/ chave=%s: %s", chave, e_resolv)
+
+    conn.commit()
+    return 'ok'
+
+
+class _Ingestao:
+    """Acumula o resultado da requisição e grava as notas em lotes."""
+
+    def __init__(self, conn, cur, tamanho_lote=None):
+        self.conn = conn
+        self.cur = cur
+        self.tamanho_lote = tamanho_lote or _LOTE
+        self.depara = DeparaVenda()
+        self.vistas = set()      # chaves já gravadas/repetidas nesta requisição
+        self.pendentes = []
+        self.ok = []
+        self.repetidas = []
+        self.canceladas = []
+        self.erros = []
+        self.notas = 0
+        self.itens = 0
+        self.lotes = 0
+
+    def nota(self, nota):
+        self.notas += 1
+        if not isinstance(nota, dict):
+            self.erros.append({"chave": None, "erro": "nota não é objeto JSON"})
+            return
+        chave = nota.get('chave')
+        if not chave:
+            self.erros.append({"chave": None, "erro": "chave ausente"})
+            return
+        # A chave vira item de set (repetidas) e parâmetro de IN: lista ou
+        # objeto no JSON derrubaria o lote inteiro com TypeError. Número é
+        # aceito como texto (a chave da NF-e são 44 dígitos).
+        if isinstance(chave, bool) or not isinstance(chave, (str, int)):
+            self.erros.append({"chave": None, "erro": "chave inválida (esperado texto)"})
+            return
+        nota['chave'] = str(chave).strip()
+        if not nota['chave']:
+            self.erros.append({"chave": None, "erro": "chave ausente"})
+            return
+        self.pendentes.append(nota)
+        if len(self.pendentes) >= self.tamanho_lote:
+            self.descarregar()
+
+    def descarregar(self):
+        lote, self.pendentes = self.pendentes, []
+        if not lote:
+            return
+        self.lotes += 1
+
+        # Validação + repetidas dentro da própria requisição.
+        candidatas = []
+        for nota in lote:
+            chave = nota['chave']
+            try:
+                itens = _itens_da_nota(nota)
+            except ValueError as e:
+                current_app.logger.warning("[api/vendas] falha ao gravar nota chave=%s: %s", chave, e)
+                self.erros.append({"chave": chave, "erro": str(e)})
+                continue
+            if chave in self.vistas:
+                self.repetidas.append(chave)
+                continue
+            self.vistas.add(chave)
+            candidatas.append((nota, itens))
+        if not candidatas:
+            return
+
+        try:
+            self._gravar_lote(candidatas)
+        except Exception as e:
+            try:
+                self.conn.rollback()
+            except Exception:
+                pass
+            current_app.logger.warning(
+                "[api/vendas] lote de %d notas falhou (%s); regravando nota a nota",
+                len(candidatas), e)
+            self._gravar_uma_a_uma(candidatas)
+
+    def _gravar_lote(self, candidatas):
+        cur = self.cur
+        chaves = [nota['chave'] for nota, _itens in candidatas]
+        marcas = ",".join(["%s"] * len(chaves))
+
+        cur.execute(f"SELECT chave FROM vendas_xml WHERE chave IN ({marcas})", chaves)
+        existentes = {_valores(r)[0] for r in cur.fetchall()}
+        novas = [(n, i) for n, i in candidatas if n['chave'] not in existentes]
+
+        if novas:
+            cur.executemany(_SQL_INSERT_CABECALHO, [_params_cabecalho(n) for n, _i in novas])
+            chaves_novas = [n['chave'] for n, _i in novas]
+            cur.execute(
+                "SELECT chave, id FROM vendas_xml WHERE chave IN (%s)"
+                % ",".join(["%s"] * len(chaves_novas)),
+                chaves_novas,
+            )
+            venda_id = {c: vid for c, vid in (_valores(r)[:2] for r in cur.fetchall())}
+
+            # Falha ao carregar o de-para NAO derruba o lote: itens sem
+            # produto_id ficam NULL, como no caminho nota-a-nota.
+            depara = self.depara
+            try:
+                depara.carregar(cur, {n.get('cnpj_emitente') for n, _i in novas})
+            except Exception as e_resolv:
+                current_app.logger.warning("[api/vendas] carregar de-para falhou: %s", e_resolv)
+                depara = None
+
+            linhas = []
+            for nota, itens in novas:
+                vid = venda_id[nota['chave']]
+                for item in itens:
+                    pid = item.get('produto_id')
+                    if pid is None and depara is not None:
+                        try:
+                            pid = depara.resolver(cur, nota.get('cnpj_emitente'),
+                                                  item.get('cprod'), item.get('cod_anp'))
+                        except Exception as e_resolv:
+                            current_app.logger.warning(
+                                "[api/vendas] resolver produto_id falhou p/ chave=%s: %s",
+                                nota['chave'], e_resolv)
+                    linhas.append(_params_item(vid, item, pid))
+            if linhas:
+                cur.executemany(_SQL_INSERT_ITEM, linhas)
+            self.itens += len(linhas)
+
+        self.conn.commit()
+        for nota, _itens in candidatas:
+            chave = nota['chave']
+            (self.repetidas if chave in existentes else self.ok).append(chave)
+
+    def _gravar_uma_a_uma(self, candidatas):
+        for nota, itens in candidatas:
+            chave = nota['chave']
+            try:
+                if _gravar_nota(self.conn, self.cur, nota) == 'ok':
+                    self.ok.append(chave)
+                    self.itens += len(itens)
+                else:
+                    self.repetidas.append(chave)
+            except Exception as e:
+                # Erro em 1 nota: rollback só dela, registra e segue.
+                try:
+                    self.conn.rollback()
+                except Exception:
+                    pass
+                self.vistas.discard(chave)
+                current_app.logger.warning("[api/vendas] falha ao gravar nota chave=%s: %s", chave, e)
+                self.erros.append({"chave": chave, "erro": str(e)})
+
+    def cancelar(self, cancelamentos):
+        conn, cur = self.conn, self.cur
+        for chave in cancelamentos:
+            try:
+                if not chave:
+                    self.erros.append({"chave": None, "erro": "cancelamento com chave vazia"})
+                    continue
+                cur.execute(_SQL_CANCELA, (chave,))
+                conn.commit()
+                if cur.rowcount and cur.rowcount > 0:
+                    self.canceladas.append(chave)
+                else:
+                    self.erros.append({"chave": chave, "erro": "cancelamento: chave não encontrada"})
+            except Exception as e:
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+                current_app.logger.warning("[api/vendas] falha ao cancelar chave=%s: %s", chave, e)
+                self.erros.append({"chave": chave, "erro": str(e)})
+
+
+def _ler_ndjson(linhas, ingestao, cancelamentos):
+    """
+    Uma nota por linha (mesmo objeto de "notas"). Linha com a chave
+    "cancelamento" (str) ou "cancelamentos" (lista) entra na fila de
+    cancelamentos, processada depois de todas as notas. Linha vazia é
+    ignorada; linha que não é JSON vira erro e a leitura segue.
+    """
+    for n, bruta in enumerate(linhas, 1):
+        bruta = bruta.strip()
+        if not bruta:
+            continue
+        try:
+            obj = json.loads(bruta)
+        except ValueError:
+            ingestao.erros.append({"chave": None, "erro": f"linha {n}: JSON inválido"})
+            continue
+        if isinstance(obj, dict) and 'chave' not in obj and (
+                'cancelamento' in obj or 'cancelamentos' in obj):
+            if 'cancelamento' in obj:
+                cancelamentos.append(obj.get('cancelamento'))
+            lista = obj.get('cancelamentos')
+            if isinstance(lista, list):
+                cancelamentos.extend(lista)
+            continue
+        ingestao.nota(obj)
+
+
 @vendas_api_bp.route('/api/vendas', methods=['POST'])
 @csrf.exempt
 def receber_vendas():
@@ -133,115 +393,60 @@ def receber_vendas():
           "cancelamentos": ["chave44", ...]
         }
 
+    Ou, com Content-Type: application/x-ndjson, uma nota por linha (lida em
+    streaming, sem carregar o corpo inteiro) e linhas
+    {"cancelamento": "chave44"} para os cancelamentos.
+
+    As notas são gravadas em lotes de VENDAS_API_LOTE (padrão 500) por
+    transação; se um lote falha, ele é regravado nota a nota para que só a
+    nota com problema vá para "erros".
+
     Resposta 200:
         {
           "ok": [chaves gravadas],
           "repetidas": [chaves que já existiam],
           "canceladas": [chaves canceladas],
           "erros": [ {"chave": ..., "erro": ...}, ... ],
-          "novas_gravadas": N
+          "novas_gravadas": N,
+          "throughput": {"notas", "itens", "lotes", "segundos", "notas_por_seg"}
         }
     """
     if not _autenticado():
         return jsonify({"ok": False, "erro": "não autorizado"}), 401
 
-    payload = request.get_json(silent=True)
-    if not isinstance(payload, dict):
-        return jsonify({"ok": False, "erro": "JSON inválido ou ausente"}), 400
-
-    notas = payload.get('notas') or []
-    cancelamentos = payload.get('cancelamentos') or []
-    if not isinstance(notas, list):
-        notas = []
-    if not isinstance(cancelamentos, list):
-        cancelamentos = []
+    ndjson = request.mimetype in _MIMES_NDJSON
+    if not ndjson:
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, dict):
+            return jsonify({"ok": False, "erro": "JSON inválido ou ausente"}), 400
 
-    ok = []
-    repetidas = []
-    canceladas = []
-    erros = []
+        notas = payload.get('notas') or []
+        cancelamentos = payload.get('cancelamentos') or []
+        if not isinstance(notas, list):
+            notas = []
+        if not isinstance(cancelamentos, list):
+            cancelamentos = []
 
+    t0 = time.monotonic()
     conn = None
     cur = None
     try:
         conn = get_db_connection()
         cur = conn.cursor()
+        ingestao = _Ingestao(conn, cur)
 
         # ---------- NOTAS ----------
-        for nota in notas:
-            chave = None
-            try:
-                if not isinstance(nota, dict):
-                    erros.append({"chave": None, "erro": "nota não é objeto JSON"})
-                    continue
-
-                chave = nota.get('chave')
-                if not chave:
-                    erros.append({"chave": None, "erro": "chave ausente"})
-                    continue
-
-                # Já existe? -> repetida, não insere.
-                cur.execute(_SQL_EXISTE, (chave,))
-                if cur.fetchone() is not None:
-                    repetidas.append(chave)
-                    continue
-
-                # Insere cabeçalho + itens numa transação própria desta nota.
-                params_cab = (tuple(nota.get(c) for c in _CAMPOS_CABECALHO)
-                              + _com_defaults(nota, _CABECALHO_NOVOS))
-                cur.execute(_SQL_INSERT_CABECALHO, params_cab)
-                venda_id = cur.lastrowid
-
-                itens = nota.get('itens') or []
-                if not isinstance(itens, list):
-                    itens = []
-                for item in itens:
-                    if not isinstance(item, dict):
-                        raise ValueError("item não é objeto JSON")
-                    params_item = ((venda_id,)
-                                   + tuple(item.get(c) for c in _CAMPOS_ITEM)
-                                   + _com_defaults(item, _ITEM_NOVOS))
-                    cur.execute(_SQL_INSERT_ITEM, params_item)
-
-                # Resolve nosso produto_id (de-para cnpj+cprod -> fallback ANP).
-                # Se o robo ja mandou produto_id, aplica so nos itens NULL.
-                # Falha aqui NAO derruba a ingestao da nota.
-                try:
-                    aplicar_depara_venda(cur, venda_id)
-                except Exception as e_resolv:
-                    current_app.logger.warning(
-                        "[api/vendas] resolver produto_id falhou p/ chave=%s: %s", chave, e_resolv)
-
-                conn.commit()
-                ok.append(chave)
-            except Exception as e:
-                # Erro em 1 nota: rollback só dela, registra e segue.
-                try:
-                    conn.rollback()
-                except Exception:
-                    pass
-                current_app.logger.warning("[api/vendas] falha ao gravar nota chave=%s: %s", chave, e)
-                erros.append({"chave": chave, "erro": str(e)})
+        if ndjson:
+            cancelamentos = []
+            linhas = (b.decode('utf-8', 'replace') for b in request.stream)
+            _ler_ndjson(linhas, ingestao, cancelamentos)
+        else:
+            for nota in notas:
+                ingestao.nota(nota)
+        ingestao.descarregar()
 
         # ---------- CANCELAMENTOS ----------
-        for chave in cancelamentos:
-            try:
-                if not chave:
-                    erros.append({"chave": None, "erro": "cancelamento com chave vazia"})
-                    continue
-                cur.execute(_SQL_CANCELA, (chave,))
-                conn.commit()
-                if cur.rowcount and cur.rowcount > 0:
-                    canceladas.append(chave)
-                else:
-                    erros.append({"chave": chave, "erro": "cancelamento: chave não encontrada"})
-            except Exception as e:
-                try:
-                    conn.rollback()
-                except Exception:
-                    pass
-                current_app.logger.warning("[api/vendas] falha ao cancelar chave=%s: %s", chave, e)
-                erros.append({"chave": chave, "erro": str(e)})
+        ingestao.cancelar(cancelamentos)
 
     except Exception:
         # Falha estrutural (ex.: sem conexão). Não deveria virar 500 silencioso.
@@ -259,10 +464,28 @@ def receber_vendas():
         except Exception:
             pass
 
+    if ingestao.ok or ingestao.canceladas:
+        # Saldo de tanque em tempo real: nota nova é acréscimo; cancelamento
+        # tira litros já somados, então pede semente nova.
+        notificar_saldo(semear=bool(ingestao.canceladas))
+
+    segundos = time.monotonic() - t0
+    throughput = {
+        "notas": ingestao.notas,
+        "itens": ingestao.itens,
+        "lotes": ingestao.lotes,
+        "segundos": round(segundos, 3),
+        "notas_por_seg": round(ingestao.notas / segundos, 1) if segundos > 0 else None,
+    }
+    current_app.logger.info(
+        "[api/vendas] %s notas (%s novas, %s itens) em %s lote(s), %.3fs",
+        ingestao.notas, len(ingestao.ok), ingestao.itens, ingestao.lotes, segundos)
+
     return jsonify({
-        "ok": ok,
-        "repetidas": repetidas,
-        "canceladas": canceladas,
-        "erros": erros,
-        "novas_gravadas": len(ok),
+        "ok": ingestao.ok,
+        "repetidas": ingestao.repetidas,
+        "canceladas": ingestao.canceladas,
+        "erros": ingestao.erros,
+        "novas_gravadas": len(ingestao.ok),
+        "throughput": throughput,
     }), 200
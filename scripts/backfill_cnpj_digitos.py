@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+# ============================================================================
+#  CNPJ so com digitos: clientes.cnpj_digitos, fornecedores.cnpj_digitos e
+#  bank_transactions.cnpj_cpf_digitos (utils/cnpj_digitos.py).
+#
+#  As colunas sao GERADAS (STORED): o proprio ALTER preenche as linhas que ja
+#  existem e o MySQL mantem o valor em todo INSERT/UPDATE -- nao ha UPDATE de
+#  backfill a fazer. clientes e fornecedores vem da migration
+#  (migrations/20261019_cnpj_digitos_guardado.sql). bank_transactions fica
+#  SO aqui: o ADD de coluna STORED reconstroi a tabela inteira (ALGORITHM=COPY,
+#  escrita bloqueada ate terminar) -- rode fora do horario, sem importacao de
+#  OFX em andamento, e reinicie o app depois: as consultas so passam a usar a
+#  coluna na partida seguinte. Este script:
+#    1. mede as consultas com o JOIN antigo (REPLACE linha a linha);
+#    2. com --aplicar, roda a migration e cria o que faltar em
+#       bank_transactions (cada ALTER so se o information_schema disser que
+#       falta);
+#    3. confere a coluna contra a normalizacao antiga e relata cadastros cujo
+#       CNPJ tem lixo alem da mascara (letra, CPF com espaco no meio...);
+#    4. mede as MESMAS consultas pela coluna indexada (antes/depois).
+#
+#  SOMENTE LEITURA por padrao. So altera o schema com --aplicar.
+#
+#  Uso:
+#     $env:DB_PASSWORD = "<senha>"
+#     python scripts/backfill_cnpj_digitos.py             # so mede e confere
+#     python scripts/backfill_cnpj_digitos.py --aplicar   # cria colunas/indices
+# ============================================================================
+import os
+import statistics
+import sys
+import time
+from datetime import timedelta
+
+import pymysql
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.db_credentials import exigir_senha, pymysql_params  # noqa: E402
+from utils.fuso import hoje_brasilia  # noqa: E402
+
+MIGRATION = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                         "migrations", "20261019_cnpj_digitos_guardado.sql")
+APLICAR = "--aplicar" in sys.argv
+REPETICOES = 5
+
+COLUNAS = (
+    ("clientes", "cnpj", "cnpj_digitos"),
+    ("fornecedores", "cnpj", "cnpj_digitos"),
+    ("bank_transactions", "cnpj_cpf", "cnpj_cpf_digitos"),
+)
+
+
+def _limpo(col):
+    return "REPLACE(REPLACE(REPLACE(REPLACE(%s,'.',''),'/',''),'-',''),' ','')" % col
+
+
+# (rotulo, sql antes, sql depois, janela em dias ate amanha; 0 = sem parametro).
+CONSULTAS = (
+    ("estoque: vendas do dia por cliente",
+     """SELECT cl.id, i.produto_id, SUM(i.quantidade)
+          FROM vendas_xml_itens i
+          JOIN vendas_xml v ON v.id = i.venda_id
+          JOIN clientes cl ON %s = v.cnpj_emitente
+         WHERE i.unidade = 'L' AND v.situacao <> 'cancelada'
+           AND v.dh_emissao >= %%s AND v.dh_emissao < %%s
+         GROUP BY cl.id, i.produto_id""" % _limpo("cl.cnpj"),
+     """SELECT cl.id, i.produto_id, SUM(i.quantidade)
+          FROM vendas_xml_itens i
+          JOIN vendas_xml v ON v.id = i.venda_id
+          JOIN clientes cl ON cl.cnpj_digitos = v.cnpj_emitente
+         WHERE i.unidade = 'L' AND v.situacao <> 'cancelada'
+           AND v.dh_emissao >= %s AND v.dh_emissao < %s
+         GROUP BY cl.id, i.produto_id""", 1),
+    ("dfe: raiz -> fornecedor",
+     """SELECT LEFT(LPAD(%s,14,'0'),8) AS raiz, MIN(id)
+          FROM fornecedores WHERE cnpj IS NOT NULL AND cnpj <> ''
+         GROUP BY 1""" % _limpo("cnpj"),
+     """SELECT LEFT(LPAD(cnpj_digitos,14,'0'),8) AS raiz, MIN(id)
+          FROM fornecedores WHERE cnpj_digitos <> ''
+         GROUP BY 1""", 0),
+    ("extrato: raiz do cnpj_cpf",
+     """SELECT LEFT(LPAD(%s,14,'0'),8) AS raiz, COUNT(*)
+          FROM bank_transactions
+         WHERE cnpj_cpf IS NOT NULL AND cnpj_cpf <> ''
+           AND data_transacao >= %%s AND data_transacao < %%s
+         GROUP BY 1""" % _limpo("cnpj_cpf"),
+     """SELECT LEFT(LPAD(cnpj_cpf_digitos,14,'0'),8) AS raiz, COUNT(*)
+          FROM bank_transactions
+         WHERE cnpj_cpf_digitos <> ''
+           AND data_transacao >= %s AND data_transacao < %s
+         GROUP BY 1""", 90),
+)
+
+
+def _coluna_existe(cur, tabela, coluna):
+    cur.execute(
+        "SELECT COUNT(*) AS n FROM INFORMATION_SCHEMA.COLUMNS "
+        "WHERE TABLE_SCHEMA=DATABASE() AND TABLE_NAME=%s AND COLUMN_NAME=%s",
+        (tabela, coluna),
+    )
+    return cur.fetchone()["n"] > 0
+
+
+def _indice_existe(cur, tabela, indice):
+    cur.execute(
+        "SELECT COUNT(*) AS n FROM INFORMATION_SCHEMA.STATISTICS "
+        "WHERE TABLE_SCHEMA=DATABASE() AND TABLE_NAME=%s AND INDEX_NAME=%s",
+        (tabela, indice),
+    )
+    return cur.fetchone()["n"] > 0
+
+
+def _params(amanha, dias):
+    return (amanha - timedelta(days=dias), amanha) if dias else ()
+
+
+def _medir(cur, sql, params):
+    tempos = []
+    for _ in range(REPETICOES):
+        t0 = time.perf_counter()
+        cur.execute(sql, params)
+        cur.fetchall()
+        tempos.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(tempos)
+
+
+def _aplicar_migration(cur):
+    with open(MIGRATION, encoding="utf-8") as f:
+        conteudo = f.read()
+    for bruto in conteudo.split(";"):
+        linhas = [ln for ln in bruto.split("\n")
+                  if ln.strip() and not ln.strip().startswith("--")]
+        if not linhas:
+            continue
+        sql = "\n".join(linhas)
+        _executar(cur, sql)
+
+
+def _executar(cur, sql):
+    t0 = time.perf_counter()
+    cur.execute(sql)
+    if cur.description is not None:
+        cur.fetchall()
+    print("  %-70s %6.1fs" % (" ".join(sql.split())[:70], time.perf_counter() - t0))
+
+
+def _aplicar_extrato(cur):
+    """bank_transactions.cnpj_cpf_digitos: reconstroi a tabela (ver topo)."""
+    if not _coluna_existe(cur, "bank_transactions", "cnpj_cpf_digitos"):
+        print("  bank_transactions: reconstruindo a tabela (escrita bloqueada)...")
+        _executar(cur, "ALTER TABLE bank_transactions ADD COLUMN cnpj_cpf_digitos"
+                       " VARCHAR(64) AS (%s) STORED" % _limpo("cnpj_cpf"))
+    if not _indice_existe(cur, "bank_transactions", "idx_bt_cnpj_cpf_digitos"):
+        _executar(cur, "CREATE INDEX idx_bt_cnpj_cpf_digitos"
+                       " ON bank_transactions (cnpj_cpf_digitos)")
+
+
+def _conferir(cur, tabela, origem, coluna):
+    cur.execute(f"""
+        SELECT COUNT(*) AS total,
+               SUM({coluna} <> {_limpo(origem)}) AS divergentes,
+               SUM({coluna} REGEXP '[^0-9]') AS com_lixo
+          FROM {tabela}
+         WHERE {origem} IS NOT NULL AND {origem} <> ''
+    """)
+    r = cur.fetchone()
+    print("  %-18s %7d com CNPJ | %d divergente(s) | %d com caractere nao numerico"
+          % (tabela, r["total"], r["divergentes"] or 0, r["com_lixo"] or 0))
+    if r["com_lixo"]:
+        cur.execute(f"""SELECT id, {origem} AS original FROM {tabela}
+                         WHERE {coluna} REGEXP '[^0-9]' LIMIT 10""")
+        for x in cur.fetchall():
+            print("      id=%-6s %r" % (x["id"], x["original"]))
+    return not r["divergentes"]
+
+
+def main():
+    exigir_senha()
+    amanha = hoje_brasilia() + timedelta(days=1)
+    con = pymysql.connect(**pymysql_params(cursorclass=pymysql.cursors.DictCursor,
+                                           read_timeout=600))
+    try:
+        cur = con.cursor()
+        cur.execute("SELECT DATABASE() AS db")
+        print("Banco:", cur.fetchone()["db"])
+        print("Modo :", "APLICAR (altera schema)" if APLICAR else "SOMENTE LEITURA (nada muda)")
+
+        print("\n[1] ANTES: JOIN com REPLACE (mediana de %d execucoes)" % REPETICOES)
+        antes = {}
+        for rotulo, sql_antes, _, dias in CONSULTAS:
+            antes[rotulo] = _medir(cur, sql_antes, _params(amanha, dias))
+            print("  %-38s %9.1f ms" % (rotulo, antes[rotulo]))
+
+        faltando = [(t, c) for t, _o, c in COLUNAS if not _coluna_existe(cur, t, c)]
+        print("\n[2] Migration")
+        if faltando and not APLICAR:
+            print("  faltam %s -- rode com --aplicar" % ", ".join("%s.%s" % x for x in faltando))
+            return
+        if APLICAR:
+            _aplicar_migration(cur)
+            _aplicar_extrato(cur)
+            con.commit()
+        else:
+            print("  colunas ja existem -- nada a aplicar")
+
+        print("\n[3] Conferencia (coluna x normalizacao antiga)")
+        ok = all([_conferir(cur, *c) for c in COLUNAS])
+
+        print("\n[4] DEPOIS: coluna indexada")
+        for rotulo, _, sql_depois, dias in CONSULTAS:
+            depois = _medir(cur, sql_depois, _params(amanha, dias))
+            print("  %-38s %9.1f ms  (antes %9.1f ms, %.1fx)"
+                  % (rotulo, depois, antes[rotulo], antes[rotulo] / depois if depois else 0))
+        if not ok:
+            sys.exit("\nHa linhas divergentes -- a coluna gerada nao bate com o REPLACE.")
+    finally:
+        con.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+"""Benchmark do relatorio de Conferencia de Cartoes (conf_cartoes._build_report).
+
+Sem banco e sem Flask. Gera um ano de vendas sinteticas (N bandeiras, uma
+linha por dia por bandeira, como _fetch_vendas devolve) e os recebimentos
+correspondentes (duas formas por bandeira de credito), roda a versao antiga
+-- sorted(...) sobre o indice inteiro por bandeira e _next_business_day dia a
+dia por venda -- e a atual (agrupamento numa passada + utils.dias_uteis),
+confere que as linhas do relatorio sao IDENTICAS e imprime os tempos.
+
+Uso:
+    python scripts/bench_conf_cartoes.py [bandeiras] [dias] [repeticoes]
+"""
+import os
+import random
+import statistics
+import sys
+import time
+from collections import defaultdict  # noqa: F401  (usado pela versao antiga)
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('SECRET_KEY', 'bench-conf-cartoes')
+
+from routes.conf_cartoes import (  # noqa: E402
+    _DIAS_PT, _MONETARY_EPSILON, _build_report, _fmt_date, _last_day_of_next_month,
+    _next_business_day, _parse_iso,
+)
+
+FERIADOS_2026 = {'2026-01-01', '2026-02-16', '2026-02-17', '2026-04-03', '2026-04-21',
+                 '2026-05-01', '2026-06-04', '2026-09-07', '2026-10-12', '2026-11-02',
+                 '2026-11-15', '2026-11-20', '2026-12-25'}
+
+
+def _build_report_antigo(bandeiras, vinculos_map, vendas_rows, recebimentos_rows, feriados_set=None, data_inicio_obj=None):
+    """Versao de antes (varreduras por bandeira + _next_business_day dia a dia)."""
+    if feriados_set is None:
+        feriados_set = set()
+
+    # Index vendas: (bandeira_id, data_iso) → total_venda
+    vendas_idx = {}
+    for r in vendas_rows:
+        d = r['data_venda']
+        if hasattr(d, 'isoformat'):
+            d = d.isoformat()
+        vendas_idx[(int(r['bandeira_id']), str(d))] = float(r['total_venda'] or 0)
+
+    # Index recebimentos: (forma_id, data_iso) → total_recebimento
+    receb_idx = {}
+    for r in recebimentos_rows:
+        d = r['data_recebimento']
+        if hasattr(d, 'isoformat'):
+            d = d.isoformat()
+        key = (int(r['forma_id']), str(d))
+        receb_idx[key] = float(r['total_recebimento'] or 0)
+
+    report = []
+    grand_total_venda = 0.0
+    grand_total_recebimento = 0.0
+    grand_total_diferenca = 0.0
+
+    for band in bandeiras:
+        bid = band['id']
+        prazo = int(band.get('prazo_compensacao_dias', 1))
+        forma_ids = vinculos_map.get(bid, [])
+        saldo_anterior = float(band.get('saldo_anterior', 0.0))
+
+        # Determina se o saldo_anterior é aplicável para este relatório.
+        # O saldo só é aplicado quando data_inicio estiver dentro do mês seguinte
+        # à data de referência do saldo (ex: saldo de 31/12/2025 aplica-se apenas
+        # a relatórios com data_inicio em janeiro/2026 ou anterior).
+        saldo_anterior_data = band.get('saldo_anterior_data')  # date ou None (do DB)
+        if saldo_anterior != 0.0 and saldo_anterior_data and data_inicio_obj:
+            if isinstance(saldo_anterior_data, str):
+                saldo_anterior_data = _parse_iso(saldo_anterior_data)
+            ultimo_dia_aplicavel = _last_day_of_next_month(saldo_anterior_data)
+            saldo_aplicavel = data_inicio_obj <= ultimo_dia_aplicavel
+        else:
+            saldo_aplicavel = False
+
+        # Todas as datas de venda desta bandeira no período
+        sale_dates = sorted(d for (b, d) in vendas_idx if b == bid)
+
+        # Todas as datas de recebimento real no período
+        all_receipt_dates = set()
+        for fid in forma_ids:
+            for (fid2, d) in receb_idx:
+                if fid2 == fid:
+                    all_receipt_dates.add(d)
+
+        if not sale_dates and not all_receipt_dates and (saldo_anterior == 0.0 or not saldo_aplicavel):
+            continue
+
+        # ── Mapeia cada data de venda → data esperada de recebimento ──────────
+        # cycles[receipt_date_iso] = [sale_date_iso, ...]
+        # Vendas pré-período (sale_date < data_inicio_obj) são incluídas SOMENTE se
+        # seu recebimento esperado cair dentro da janela consultada. Isso garante
+        # que o usuário veja as vendas de sex/sáb anteriores que chegam junto com
+        # a primeira segunda-feira do período, permitindo conferência correta.
+        cycles = defaultdict(list)
+        for sd in sale_dates:
+            sd_obj = _parse_iso(sd)
+            if sd_obj:
+                rd_obj = sd_obj if prazo == 0 else _next_business_day(sd_obj, prazo, feriados_set)
+                # Ignora vendas pré-período cujo recebimento já ocorreu antes do período
+                if data_inicio_obj and rd_obj < data_inicio_obj:
+                    continue
+                cycles[rd_obj.isoformat()].append(sd)
+
+        # Recebimentos sem venda correspondente no período (ex: créditos avulsos)
+        for rd in all_receipt_dates:
+            if rd not in cycles:
+                cycles[rd] = []
+
+        sorted_cycle_dates = sorted(cycles.keys())
+        if not sorted_cycle_dates:
+            continue
+
+        # ── Monta as linhas agrupadas por ciclo ───────────────────────────────
+        linhas = []
+        total_venda = 0.0
+        total_recebimento = 0.0
+        total_diferenca = 0.0
+        saldo = 0.0          # DIF acumulada (sign: negativo = taxas cobradas)
+        is_first_cycle = True
+
+        for rd in sorted_cycle_dates:
+            cycle_sale_dates = sorted(cycles[rd])
+            actual_receipt = sum(receb_idx.get((fid, rd), 0.0) for fid in forma_ids)
+            cycle_venda = sum(vendas_idx.get((bid, sd), 0.0) for sd in cycle_sale_dates)
+
+            # No 1º ciclo: se o saldo_anterior for aplicável para o período consultado,
+            # soma-o às vendas efetivas (pré-período pendentes de liquidação no 1º recebimento).
+            # O saldo NÃO é aplicado quando data_inicio está fora do mês de aplicabilidade
+            # (ex: saldo de dez/2025 não se aplica a consultas de fev/2026 em diante, pois os
+            # recebimentos de janeiro já liquidaram esse saldo).
+            effective_sales = cycle_venda
+            if is_first_cycle and saldo_aplicavel:
+                effective_sales += saldo_anterior
+            is_first_cycle = False
+
+            # Taxa do ciclo: positivo = operadora descontou; negativo = pagou a mais
+            # Só calculamos taxa e DIF quando há recebimento real
+            has_receipt = actual_receipt > _MONETARY_EPSILON
+            cycle_fee = (effective_sales - actual_receipt) if has_receipt else 0.0
+            pct = (cycle_fee / effective_sales * 100) if (has_receipt and effective_sales) else None
+
+            rd_obj = _parse_iso(rd)
+            dia_semana_rd = _DIAS_PT[rd_obj.weekday()] if rd_obj else ''
+            num_sale_rows = len(cycle_sale_dates)
+
+            if num_sale_rows == 0:
+                # Recebimento avulso sem vendas no período
+                if has_receipt:
+                    saldo += actual_receipt
+                    total_diferenca -= actual_receipt  # recebimento sem venda = overpayment (negative fee)
+                is_destaque_rd = (rd_obj is not None and rd_obj.weekday() >= 5) or (rd in feriados_set)
+                linhas.append({
+                    'data_venda': '',
+                    'total_venda': 0.0,
+                    'data_recebimento': _fmt_date(rd) if has_receipt else '',
+                    'total_recebimento': actual_receipt,
+                    'diferenca': -actual_receipt if has_receipt else None,
+                    'saldo_acumulado': saldo if has_receipt else None,
+                    'porcentagem': None,
+                    'data_iso': rd,
+                    'dia_semana': '',
+                    'dia_semana_recebimento': dia_semana_rd,
+                    'is_destaque': is_destaque_rd,
+                    'is_preperiodo': False,
+                })
+            else:
+                if has_receipt:
+                    saldo -= cycle_fee  # saldo += actual_receipt - effective_sales
+                    total_diferenca += cycle_fee
+
+                for i, sd in enumerate(cycle_sale_dates):
+                    venda = vendas_idx.get((bid, sd), 0.0)
+                    is_last = (i == num_sale_rows - 1)
+
+                    sd_obj = _parse_iso(sd)
+                    dia_semana_sd = _DIAS_PT[sd_obj.weekday()] if sd_obj else ''
+                    is_destaque = (sd_obj is not None and sd_obj.weekday() >= 5) or (sd in feriados_set)
+                    is_preperiodo = data_inicio_obj is not None and sd_obj is not None and sd_obj < data_inicio_obj
+
+                    if is_last:
+                        # Última venda do ciclo: exibe recebimento, diferença, DIF e %
+                        # Sempre mostra a data de recebimento esperada (mesmo sem recebimento)
+                        linhas.append({
+                            'data_venda': _fmt_date(sd),
+                            'total_venda': venda,
+                            'data_recebimento': _fmt_date(rd),
+                            'total_recebimento': actual_receipt,
+                            'diferenca': cycle_fee if has_receipt else None,
+                            'saldo_acumulado': saldo if has_receipt else None,
+                            'porcentagem': pct,
+                            'data_iso': sd,
+                            'dia_semana': dia_semana_sd,
+                            'dia_semana_recebimento': dia_semana_rd,
+                            'is_destaque': is_destaque,
+                            'is_preperiodo': is_preperiodo,
+                        })
+                    else:
+                        # Linhas intermediárias: mostra data esperada de recebimento, sem valor
+                        linhas.append({
+                            'data_venda': _fmt_date(sd),
+                            'total_venda': venda,
+                            'data_recebimento': _fmt_date(rd),
+                            'total_recebimento': 0.0,
+                            'diferenca': None,
+                            'saldo_acumulado': None,
+                            'porcentagem': None,
+                            'data_iso': sd,
+                            'dia_semana': dia_semana_sd,
+                            'dia_semana_recebimento': dia_semana_rd,
+                            'is_destaque': is_destaque,
+                            'is_preperiodo': is_preperiodo,
+                        })
+
+            total_venda += cycle_venda
+            total_recebimento += actual_receipt
+
+        if not linhas:
+            continue
+
+        grand_total_venda += total_venda
+        grand_total_recebimento += total_recebimento
+        grand_total_diferenca += total_diferenca
+
+        # Build names of linked formas for display
+        forma_nomes = [v['forma_recebimento_nome'] for v in band.get('vinculos', [])]
+
+        report.append({
+            'bandeira_id': bid,
+            'bandeira_nome': band['nome'],
+            'tipo_cartao': band['tipo'],
+            'forma_recebimento_ids': forma_ids,
+            'forma_recebimento_nome': ' + '.join(forma_nomes) if forma_nomes else '',
+            'linhas': linhas,
+            'total_venda': total_venda,
+            'total_recebimento': total_recebimento,
+            'total_diferenca': total_diferenca,
+            'saldo_anterior': saldo_anterior,
+            'saldo_anterior_aplicavel': saldo_aplicavel,
+            'saldo_final': saldo,
+        })
+
+    grand_saldo = grand_total_recebimento - grand_total_venda
+
+    return report, grand_total_venda, grand_total_recebimento, grand_total_diferenca, grand_saldo
+
+
+
+def gerar(n_bandeiras, dias, seed=7):
+    rnd = random.Random(seed)
+    inicio = date(2026, 1, 1)
+    bandeiras, vinculos_map, vendas, receb = [], {}, [], []
+    for b in range(1, n_bandeiras + 1):
+        credito = b % 3 != 0
+        formas = [1000 + 2 * b, 1001 + 2 * b] if credito else [1000 + 2 * b]
+        prazo = rnd.choice((1, 2, 30)) if credito else rnd.choice((0, 1))
+        bandeiras.append({
+            'id': b, 'nome': 'Bandeira %d' % b, 'tipo': 'CREDITO' if credito else 'DEBITO',
+            'prazo_compensacao_dias': prazo,
+            'saldo_anterior': 1500.0 if b % 5 == 0 else 0.0,
+            'saldo_anterior_data': date(2025, 12, 31) if b % 5 == 0 else None,
+            'vinculos': [{'forma_recebimento_id': f, 'forma_recebimento_nome': 'F%d' % f}
+                         for f in formas],
+        })
+        vinculos_map[b] = formas
+        for i in range(-14, dias):
+            d = inicio + timedelta(days=i)
+            if rnd.random() < 0.9:
+                vendas.append({'data_venda': d, 'bandeira_id': b,
+                               'total_venda': round(rnd.uniform(200, 9000), 2)})
+            if i >= 0 and d.weekday() < 5 and rnd.random() < 0.8:
+                receb.append({'data_recebimento': d, 'forma_id': rnd.choice(formas),
+                              'total_recebimento': round(rnd.uniform(200, 9000), 2)})
+    return bandeiras, vinculos_map, vendas, receb, inicio
+
+
+def _mediana(fn, args, repeticoes):
+    tempos, r = [], None
+    for _ in range(repeticoes):
+        t0 = time.perf_counter()
+        r = fn(*args)
+        tempos.append(time.perf_counter() - t0)
+    return statistics.median(tempos), r
+
+
+def main():
+    n_band = int(sys.argv[1]) if len(sys.argv) > 1 else 45
+    dias = int(sys.argv[2]) if len(sys.argv) > 2 else 365
+    repeticoes = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+    bandeiras, vinculos_map, vendas, receb, inicio = gerar(n_band, dias)
+    args = (bandeiras, vinculos_map, vendas, receb, FERIADOS_2026, inicio)
+    print('%d bandeiras, %d dias: %d linhas de venda, %d de recebimento'
+          % (n_band, dias, len(vendas), len(receb)))
+
+    t_antes, r_antes = _mediana(_build_report_antigo, args, repeticoes)
+    t_agora, r_agora = _mediana(_build_report, args, repeticoes)
+    assert r_antes == r_agora, 'relatorios diferentes!'
+    linhas = sum(len(b['linhas']) for b in r_agora[0])
+    print('linhas do relatorio: %d (identicas)' % linhas)
+    print('antes: %8.1f ms' % (t_antes * 1000))
+    print('agora: %8.1f ms  (%.1fx)' % (t_agora * 1000, t_antes / t_agora))
+
+
+if __name__ == '__main__':
+    main()
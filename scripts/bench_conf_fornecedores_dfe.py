@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""Benchmark do rateio FIFO da conferencia de fornecedores (DF-e): lista
+refeita a cada pagamento (antigo) x deque de notas em aberto.
+
+Sem banco e sem Flask. Gera a linha do tempo de um fornecedor grande
+(distribuidora de combustivel: muitas notas e pagamentos pequenos, que
+deixam muitas notas em aberto ao mesmo tempo) em volumes crescentes, roda
+`_aloca_fifo_lista` e `_aloca_fifo` sobre copias da mesma linha do tempo,
+confere que sobra, descoberto, faltas e marcas coberta/parcial sao iguais e
+imprime os tempos. O antigo cresce com notas_abertas x pagamentos; o novo,
+com o numero de linhas.
+
+Uso:
+    python scripts/bench_conf_fornecedores_dfe.py [n_linhas_max]
+"""
+import copy
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('DB_PASSWORD', 'teste-offline')
+os.environ.setdefault('SECRET_KEY', 'x')
+
+from routes.conf_fornecedores_dfe import _aloca_fifo  # noqa: E402
+
+
+def _aloca_fifo_lista(linhas, saldo_anterior):
+    """Semântica de referência: a versão antiga, que refazia a lista de notas
+    em aberto a cada pagamento (O(notas) por pagamento).
+
+    Fica aqui, fora da rota, para o benchmark e para o teste de equivalência
+    (test_conf_fornecedores_dfe.py); o caminho de produção é `_aloca_fifo`.
+    """
+    # Saldo anterior positivo é dinheiro disponível; negativo é nota velha em
+    # aberto que não está na lista (fora do período), mas precisa continuar
+    # contando — senão a sobra apareceria maior do que é.
+    caixa = max(saldo_anterior, 0.0)
+    descoberto_antigo = max(-saldo_anterior, 0.0)
+
+    abertas = []
+    for l in linhas:
+        if l['tipo'] == 'devolucao':
+            # Dinheiro que voltou. Se casou com um pagamento (valor exato), o
+            # livre daquele pagamento já foi zerado — aqui não faz nada. Sem
+            # par, sai do caixa; o que o caixa não cobrir vira descoberto.
+            if not l.get('abatida_de'):
+                tira = min(caixa, l['valor'])
+                caixa -= tira
+                descoberto_antigo += l['valor'] - tira
+            continue
+        if l['tipo'] == 'pagamento':
+            # Só a parte LIVRE do pagamento entra no rateio automático: o que
+            # já foi amarrado à mão tem dono — e o que foi devolvido, também.
+            caixa += max(l['valor'] - l.get('usado', 0.0)
+                         - l.get('dev_abatido', 0.0), 0.0)
+            # Primeiro tapa o buraco velho, depois as notas em aberto.
+            usa = min(caixa, descoberto_antigo)
+            caixa -= usa
+            descoberto_antigo -= usa
+            for n in abertas:
+                if caixa <= 0.005:
+                    break
+                usa = min(caixa, n['falta'])
+                n['falta'] -= usa
+                caixa -= usa
+            abertas = [n for n in abertas if n['falta'] > 0.005]
+        else:
+            # A nota já entra abatida do que foi vinculado à mão e do
+            # que foi quitado antes do corte.
+            l['falta'] = max(l['valor'] - l.get('vinc_total', 0.0)
+                             - l.get('quitado_pre', 0.0), 0.0)
+            usa = min(caixa, l['falta'])
+            l['falta'] -= usa
+            caixa -= usa
+            if l['falta'] > 0.005:
+                abertas.append(l)
+
+    for l in linhas:
+        if l['tipo'] == 'nota':
+            l['coberta'] = l['falta'] <= 0.005
+            l['parcial'] = (not l['coberta']) and l['falta'] < l['valor'] - 0.005
+
+    descoberto = descoberto_antigo + sum(n['falta'] for n in abertas)
+    return caixa, descoberto
+
+
+def linha_do_tempo(n, seed=5):
+    """Metade notas, metade pagamentos; cada pagamento cobre ~80% de uma nota."""
+    rnd = random.Random(seed)
+    linhas = []
+    for i in range(n):
+        if i % 2:
+            linhas.append({'tipo': 'pagamento', 'id': i, 'valor': round(rnd.uniform(8000, 32000), 2),
+                           'usado': 0.0})
+        else:
+            linhas.append({'tipo': 'nota', 'id': i, 'valor': round(rnd.uniform(10000, 40000), 2)})
+    return linhas
+
+
+def medir(fn, linhas):
+    t0 = time.perf_counter()
+    r = fn(linhas, -15000.0)
+    return r, time.perf_counter() - t0
+
+
+def main():
+    n_max = int(sys.argv[1]) if len(sys.argv) > 1 else 32_000
+    n = 2_000
+    print("linhas   antigo     novo   notas em aberto no fim")
+    while n <= n_max:
+        base = linha_do_tempo(n)
+        a, b = copy.deepcopy(base), copy.deepcopy(base)
+        ra, sa = medir(_aloca_fifo_lista, a)
+        rb, sb = medir(_aloca_fifo, b)
+        assert ra == rb and a == b, "rateio diferente"
+        abertas = sum(1 for l in b if l['tipo'] == 'nota' and not l['coberta'])
+        print(f"{n:6d} {sa:7.3f}s {sb:7.3f}s   {abertas:6d}   ({sa / sb:.0f}x)")
+        n *= 2
+    print("OK: mesmo rateio em todos os volumes")
+
+
+if __name__ == '__main__':
+    main()
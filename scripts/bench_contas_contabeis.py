@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""Benchmark da resolucao de contas da exportacao contabil: mapas relidos +
+_resolver_contas_contabeis (antigo) x Resolvedor guardado por versao (novo).
+
+Sem banco. Gera a configuracao (coligadas de todas as contas com todas as
+empresas, categorias de despesa, fornecedores, CNPJ, troco PIX) e n
+transacoes sinteticas -- transferencias com e sem conta conhecida, despesas
+vinculadas, troco PIX, fornecedor, so CNPJ, creditos -- e mede, por
+exportacao:
+
+  - antigo: o mapa de despesas por transacao montado a partir das linhas de
+    lancamentos_despesas (uma por lancamento vinculado, como a consulta
+    antiga devolvia) e _resolver_contas_contabeis linha a linha, com a
+    varredura do mapa de coligadas nas transferencias;
+  - novo: Resolvedor montado uma vez (depois fica no cache ate a proxima
+    gravacao) e Resolvedor.contas com despesa_categorias da propria linha.
+
+Confere que as duas saidas sao iguais para todas as transacoes.
+
+Uso:
+    python scripts/bench_contas_contabeis.py [n_transacoes] [n_empresas]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('DB_PASSWORD', 'teste-offline')
+os.environ.setdefault('SECRET_KEY', 'x')
+
+from routes.bank_import import _resolver_contas_contabeis  # noqa: E402
+from utils.contas_contabeis import Resolvedor  # noqa: E402
+
+CATEGORIAS = list(range(1, 61))
+
+
+def configuracao(n_empresas, rnd):
+    contas = {e: [e * 10 + 1, e * 10 + 2] for e in range(1, n_empresas + 1)}
+    m = {'coligada': {}, 'categoria': {}, 'fornecedor': {}, 'cnpj': {}, 'troco_pix': {},
+         'cartao': {}}
+    for e in contas:
+        m['troco_pix'][e] = (f'3.1.{e}', f'TROCO PIX EMP {e}')
+        for c in CATEGORIAS:
+            if rnd.random() < 0.8:
+                m['categoria'][(c, e)] = (f'5.2.{c:03d}', f'DESPESA {c}')
+        for f in range(1, 201):
+            if (f + e) % 3:
+                m['fornecedor'][(f, e)] = (f'2.1.{f:03d}', f'FORNECEDOR {f}')
+            m['cnpj'][(f'{f:014d}', e)] = (f'2.2.{f:03d}', f'FORNECEDOR CNPJ {f}')
+        for ba in contas[e]:
+            for outra in contas:
+                if outra != e and rnd.random() < 0.7:
+                    m['coligada'][(ba, outra)] = {
+                        'debito': (f'1.9.{outra}' if rnd.random() < 0.8 else '', f'MUTUO A RECEBER {outra}'),
+                        'credito': (f'2.9.{outra}', f'MUTUO A PAGAR {outra}'),
+                    }
+    return contas, m
+
+
+def transacoes(n, contas, rnd):
+    empresas = list(contas)
+    txs, lancamentos = [], []
+    for bt_id in range(1, n + 1):
+        e = rnd.choice(empresas)
+        outra = rnd.choice(empresas)
+        tipo = 'DEBIT' if rnd.random() < 0.6 else 'CREDIT'
+        sorte = rnd.random()
+        conc = ('transferencia' if sorte < 0.15 else 'troco_pix' if sorte < 0.2
+                else 'fornecedor' if tipo == 'DEBIT' else 'recebimento')
+        cats = []
+        if tipo == 'DEBIT' and conc == 'fornecedor' and rnd.random() < 0.5:
+            cats = [(rnd.choice(CATEGORIAS), e) for _ in range(rnd.choice((1, 1, 2)))]
+            lancamentos.extend((bt_id, c, emp) for c, emp in cats)
+        f = rnd.randrange(1, 260)
+        txs.append({
+            'id': bt_id, 'account_id': rnd.choice(contas[e]) if rnd.random() < 0.9 else None,
+            'tipo': tipo, 'tipo_conciliacao': conc, 'banco_cliente_id': e,
+            'conta_banco_codigo': f'1.1.1.{e}', 'conta_banco_nome': f'BANCO {e}',
+            'fornecedor_id': f if f < 150 else None,
+            'cnpj_cpf_digitos': f'{f:014d}' if rnd.random() < 0.6 else '',
+            'conta_destino_id': rnd.choice(contas[outra]), 'destino_cliente_id': outra,
+            'conta_destino_codigo': f'1.1.1.{outra}', 'conta_destino_nome': f'BANCO {outra}',
+            'origem_cliente_id': outra,
+            'conta_origem_codigo': f'1.1.1.{outra}' if outra % 4 else '',
+            'conta_origem_nome': f'BANCO {outra}',
+            'conta_fr_codigo': '4.2.1', 'conta_fr_nome': 'RECEITA PIX',
+            'despesa_categorias': ','.join(f'{c}:{emp}' for c, emp in cats) or None,
+        })
+    return txs, lancamentos
+
+
+def antigo(txs, lancamentos, m):
+    # consulta antiga: lancamentos_despesas JOIN categoria_despesa_contas, 1a conta por transacao
+    despesa = {}
+    for bt_id, c, e in lancamentos:
+        conta = m['categoria'].get((c, e))
+        if conta and bt_id not in despesa:
+            despesa[bt_id] = conta
+    return [_resolver_contas_contabeis(r, despesa, m['coligada'], m['fornecedor'], m['cnpj'],
+                                       troco_pix_conta_map=m['troco_pix']) for r in txs]
+
+
+def novo(txs, m):
+    res = Resolvedor(m)
+    contas, despesa = res.contas, res.despesa
+    return [contas(r, despesa(r['despesa_categorias'])) for r in txs]
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    n_empresas = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    rnd = random.Random(23)
+    contas, m = configuracao(n_empresas, rnd)
+    txs, lancamentos = transacoes(n, contas, rnd)
+    print(f"{n} transacoes, {len(m['coligada'])} coligadas, {len(lancamentos)} lancamentos de despesa")
+
+    t0 = time.perf_counter()
+    a = antigo(txs, lancamentos, m)
+    t1 = time.perf_counter()
+    b = novo(txs, m)
+    t2 = time.perf_counter()
+    assert a == b, "contas diferentes"
+    print(f"  antigo (mapa de despesas + resolver) {t1 - t0:7.2f}s")
+    print(f"  novo   (Resolvedor)                  {t2 - t1:7.2f}s   {(t1 - t0) / (t2 - t1):.1f}x")
+    print("OK: mesmas contas para todas as transacoes")
+
+
+if __name__ == '__main__':
+    main()
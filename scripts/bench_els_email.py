@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""Benchmark da importacao ELS: FETCH por mensagem (antigo) x lotes de UID.
+
+Sem banco e sem rede: sobe scripts/fake_imap.py com latencia por comando,
+gera N e-mails do ELS e roda
+
+  - o caminho antigo: um `UID FETCH <uid>` por mensagem, HTML -> texto com
+    HTMLParser e, na gravacao, um SELECT do cadastro de produtos e um INSERT
+    por tanque, commit por mensagem;
+  - integrations.els_email._processar_caixa: UID FETCH por conjunto, pipeline
+    (o lote seguinte chega enquanto o atual e gravado) e executemany.
+
+Confere que as linhas gravadas sao identicas e imprime tempos e idas ao
+IMAP/banco.
+
+Uso:
+    python scripts/bench_els_email.py [n_mensagens] [latencia_ms]
+"""
+import email
+import imaplib
+import os
+import sys
+import time
+from html.parser import HTMLParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault('DB_PASSWORD', 'teste-offline')
+os.environ.setdefault('SECRET_KEY', 'x')
+
+from fake_imap import FakeImap, gerar_mensagens  # noqa: E402
+
+from integrations import els_email as E  # noqa: E402
+
+
+class Banco:
+    """Conta as idas ao "MySQL" e guarda o que foi gravado."""
+
+    def __init__(self):
+        self.idas = 0
+        self.linhas = {}
+
+    def cursor(self, dictionary=False):
+        return self
+
+    def execute(self, sql, params=()):
+        self.idas += 1
+        self._linhas = []
+        if 'FROM produto' in sql:
+            self._linhas = [{'id': 1, 'nome': 'GASOLINA COMUM'}, {'id': 2, 'nome': 'ETANOL'},
+                            {'id': 3, 'nome': 'DIESEL S-10'}, {'id': 4, 'nome': 'DIESEL S-500'}]
+        elif 'FROM descargas_pendentes' in sql:
+            self._linhas = [{'chave': c, 'id': 1, 'status': 'pendente'}
+                            for c in params if ('d', c) in self.linhas]
+        elif 'INTO leitura_tanque_diaria' in sql:
+            self.linhas[('l', params[0], params[1], params[3])] = params
+        elif 'INTO descargas_pendentes' in sql:
+            self.linhas[('d', params[-1])] = params
+
+    def executemany(self, sql, seq):
+        self.idas += 1
+        n = self.idas
+        for p in seq:
+            self.execute(sql, p)
+        self.idas = n
+
+    def fetchone(self):
+        return self._linhas[0] if self._linhas else None
+
+    def fetchall(self):
+        return self._linhas
+
+    def commit(self):
+        self.idas += 1
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+# ---------------------------------------------------------------------------
+# Caminho antigo (copiado de integrations/els_email.py antes dos lotes)
+# ---------------------------------------------------------------------------
+
+class _HTMLToText(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self._parts = []
+
+    def handle_data(self, data):
+        self._parts.append(data)
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("br", "p", "div", "tr", "li"):
+            self._parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in ("p", "div", "tr", "li"):
+            self._parts.append("\n")
+
+    def get_text(self):
+        return "".join(self._parts)
+
+
+def _html_txt_antigo(html):
+    p = _HTMLToText()
+    p.feed(html)
+    return p.get_text()
+
+
+def processar_antigo(banco, cliente_id):
+    M = imaplib.IMAP4(os.environ['ELS_MAIL_IMAP_HOST'], int(os.environ['ELS_MAIL_IMAP_PORT']))
+    M.login('u', 'p')
+    M.select('INBOX')
+    typ, dados = M.uid("SEARCH", None, '(FROM "%s" UNSEEN)' % E.REMETENTE_PADRAO)
+    mensagens = []
+    for uid in dados[0].split():
+        typ, raw = M.uid("FETCH", uid, "(BODY.PEEK[])")
+        msg = email.message_from_bytes(raw[0][1])
+        html = msg.get_payload(decode=True).decode(msg.get_content_charset() or 'utf-8')
+        mensagens.append((uid.decode(), E._decode(msg.get("Subject", "")),
+                          _html_txt_antigo(html)))
+    M.logout()
+    for uid, assunto, texto in mensagens:
+        tipo = E.detectar_tipo(assunto, texto)
+        if tipo == "ABERTURA":
+            E.gravar_abertura(banco, E.parse_abertura(texto), cliente_id)
+            banco.commit()
+        elif tipo == "DESCARGA":
+            dc = E.parse_descarga(texto)
+            if dc:
+                E.gravar_descarga(banco, dc, cliente_id)
+                banco.commit()
+
+
+def rodar(rotulo, fake, fn):
+    banco = Banco()
+    fake.comandos.clear()
+    t0 = time.perf_counter()
+    fn(banco)
+    seg = time.perf_counter() - t0
+    print(f"  {rotulo:<8} {seg:7.2f}s  imap={len(fake.comandos):5d} comandos"
+          f"  banco={banco.idas:6d} idas  linhas={len(banco.linhas)}")
+    return seg, banco.linhas
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    latencia = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.005
+    fake = FakeImap(gerar_mensagens(n), atraso=latencia).iniciar()
+    os.environ.update(ELS_MAIL_IMAP_HOST='127.0.0.1', ELS_MAIL_IMAP_PORT=str(fake.porta),
+                      ELS_MAIL_IMAP_SSL='0', ELS_MAIL_USER='u', ELS_MAIL_PASSWORD='p')
+    print(f"{n} e-mails, {latencia * 1000:.0f} ms por comando IMAP, lote {E.LOTE_FETCH}")
+    try:
+        antes, l1 = rodar('antigo', fake, lambda b: processar_antigo(b, 7))
+        depois, l2 = rodar('lotes', fake, lambda b: E._processar_caixa(b, b, 7, 1, True))
+    finally:
+        fake.parar()
+    assert l1 == l2, "resultados diferentes"
+    print(f"OK: mesmas {len(l1)} linhas; {antes / depois:.1f}x mais rapido")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,400 @@
+# -*- coding: utf-8 -*-
+"""Benchmark da exportacao contabil: listas + sort + Workbook (antigo) x streaming.
+
+Sem banco: gera transacoes conciliadas, vendas e taxas de cartao sinteticas
+(ja em ordem de data, como os cursores devolvem) e roda
+
+  - o caminho antigo: tudo em listas, dict(r, _kind=...), sort da lista
+    concatenada e openpyxl.Workbook normal salvo num BytesIO (ou o CSV num
+    StringIO);
+  - routes.bank_import._contabil_registros (heapq.merge das tres fontes) com
+    _contabil_csv / _contabil_xlsx (write-only, arquivo temporario).
+
+Primeiro compara os dois num volume menor (--comparar, default 5000): CSV
+byte a byte e XLSX celula a celula (valor, preenchimento, formato, aba de
+avisos). Depois mede o caminho novo no volume cheio (default 1.000.000 de
+transacoes) e num volume 10x menor: o pico de memoria (tracemalloc) tem de
+ficar praticamente igual nos dois -- e o que "memoria constante" quer dizer.
+
+Uso:
+    python scripts/bench_exportar_contabil.py [n_transacoes] [--comparar N] [--xlsx N]
+
+O Excel fica num volume menor (--xlsx, default 50000): sem lxml o openpyxl
+serializa ~3-4 mil linhas/s nos dois caminhos, e 1M de linhas levaria uns
+5 minutos so para provar a mesma coisa. O CSV vai no volume cheio.
+"""
+import argparse
+import csv
+import datetime as dt
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('DB_PASSWORD', 'teste-offline')
+os.environ.setdefault('SECRET_KEY', 'x')
+
+import openpyxl  # noqa: E402
+
+from routes import bank_import as B  # noqa: E402
+from utils.contas_contabeis import Resolvedor  # noqa: E402
+
+INICIO = dt.date(2026, 1, 1)
+DIAS = 365
+EMPRESAS = list(range(1, 11))
+BANDEIRAS = list(range(1, 5))
+POSTOS = EMPRESAS[:5]            # empresas com vendas de cartao
+CONTAS = {e: [e * 10 + 1, e * 10 + 2] for e in EMPRESAS}   # contas bancarias por empresa
+
+
+def mapas():
+    m = {
+        'coligada': {}, 'despesa': {}, 'categoria': {}, 'fornecedor': {}, 'cnpj': {},
+        'troco_pix': {}, 'cartao': {},
+    }
+    for e in EMPRESAS:
+        m['troco_pix'][e] = (f'3.1.{e}', f'TROCO PIX EMP {e}')
+        for f in range(1, 41):
+            if (f + e) % 3:
+                m['fornecedor'][(f, e)] = (f'2.1.{f:03d}', f'FORNECEDOR {f}')
+            m['cnpj'][(f'{f:014d}', e)] = (f'2.2.{f:03d}', f'FORNECEDOR CNPJ {f}')
+        for b in BANDEIRAS:
+            m['cartao'][(b, e)] = {
+                'bandeira_nome': f'BANDEIRA {b}', 'tipo_cartao': 'CREDITO' if b % 2 else 'DEBITO',
+                'credito': (f'4.1.{b}', f'RECEITA CARTAO {b}'),
+                'debito': (f'1.1.{b}', f'CARTOES A RECEBER {b}'),
+                'despesa': (f'5.1.{b}', f'TAXA ADM {b}'),
+            }
+        for outra in EMPRESAS:
+            if outra != e and (e + outra) % 4:
+                m['coligada'][(CONTAS[e][0], outra)] = {
+                    'debito': (f'1.9.{outra}', f'MUTUO A RECEBER {outra}'),
+                    'credito': (f'2.9.{outra}', f'MUTUO A PAGAR {outra}'),
+                }
+    return m
+
+
+def transacoes(n, seed=11):
+    """n transacoes conciliadas, em ordem de (data, id), ja marcadas como
+    _contabil_transacoes marca as linhas do cursor."""
+    rnd = random.Random(seed)
+    por_dia, resto = divmod(n, DIAS)
+    bt_id = 0
+    for d in range(DIAS):
+        dia = INICIO + dt.timedelta(days=d)
+        for _ in range(por_dia + (1 if d < resto else 0)):
+            bt_id += 1
+            e = rnd.choice(EMPRESAS)
+            conta = rnd.choice(CONTAS[e])
+            tipo = 'DEBIT' if rnd.random() < 0.6 else 'CREDIT'
+            sorte = rnd.random()
+            conc = ('transferencia' if sorte < 0.08 else 'troco_pix' if sorte < 0.12
+                    else 'fornecedor' if tipo == 'DEBIT' else 'recebimento')
+            outra = rnd.choice(EMPRESAS)
+            f = rnd.randrange(1, 50)
+            sem_plano = rnd.random() < 0.03
+            yield {
+                '_kind': 'bank', 'id': bt_id, 'account_id': conta, 'data_transacao': dia, 'tipo': tipo,
+                'valor': Decimal(rnd.randrange(100, 5000000)) / 100,
+                'descricao': f'PIX {conc.upper()} {bt_id} DOC {rnd.randrange(10 ** 8)}',
+                'cnpj_cpf': None, 'cnpj_cpf_digitos': f'{f:014d}' if rnd.random() < 0.5 else '',
+                'tipo_conciliacao': conc, 'forma_recebimento_id': 1, 'fornecedor_id': f if f < 30 else None,
+                'conta_destino_id': CONTAS[outra][1],
+                'conta_apelido': f'CONTA {conta}', 'banco_nome': 'SICREDI', 'banco_cliente_id': e,
+                'conta_banco_codigo': '' if sem_plano else f'1.1.1.{conta}',
+                'conta_banco_nome': '' if sem_plano else f'BANCO CONTA {conta}',
+                'destino_cliente_id': outra, 'conta_destino_banco_nome': f'BANCO DESTINO {outra}',
+                'conta_destino_codigo': '' if outra % 5 == 0 else f'1.1.1.{CONTAS[outra][1]}',
+                'conta_destino_nome': '' if outra % 5 == 0 else f'BANCO CONTA {CONTAS[outra][1]}',
+                'origem_cliente_id': outra, 'conta_origem_codigo': f'1.1.1.{CONTAS[outra][0]}',
+                'conta_origem_nome': f'BANCO CONTA {CONTAS[outra][0]}',
+                'empresa_nome': f'EMPRESA {e} LTDA', 'forma_recebimento_nome': 'PIX',
+                'conta_fr_codigo': '4.2.1' if rnd.random() < 0.9 else '', 'conta_fr_nome': 'RECEITA PIX',
+            }
+
+
+def vendas(seed=12):
+    rnd = random.Random(seed)
+    m = mapas()['cartao']
+    for d in range(DIAS):
+        dia = INICIO + dt.timedelta(days=d)
+        for e in POSTOS:
+            for b in sorted(BANDEIRAS, key=lambda b: ('CREDITO' if b % 2 else 'DEBITO', b)):
+                c = m[(b, e)]
+                yield {'_kind': 'card', 'data_venda': dia, 'empresa_nome': f'POSTO {e}',
+                       'bandeira_nome': c['bandeira_nome'], 'tipo_cartao': c['tipo_cartao'],
+                       'total_venda': rnd.randrange(10000, 900000) / 100,
+                       'credito_cod': c['credito'][0], 'credito_nome': c['credito'][1],
+                       'debito_cod': c['debito'][0], 'debito_nome': c['debito'][1]}
+
+
+def taxas(seed=13):
+    rnd = random.Random(seed)
+    m = mapas()['cartao']
+    for d in range(DIAS):
+        dia = INICIO + dt.timedelta(days=d)
+        if dia.weekday() >= 5:
+            continue
+        for e in POSTOS:
+            for b in BANDEIRAS:
+                c = m[(b, e)]
+                yield {'_kind': 'fee', 'data_recebimento': dia, 'empresa_nome': f'POSTO {e}',
+                       'bandeira_nome': c['bandeira_nome'], 'tipo_cartao': c['tipo_cartao'],
+                       'cycle_fee': round(rnd.randrange(100, 20000) / 100, 2),
+                       'debito_cod': c['despesa'][0], 'debito_nome': c['despesa'][1],
+                       'credito_cod': c['debito'][0], 'credito_nome': c['debito'][1]}
+
+
+# ---------------------------------------------------------------------------
+# Caminho antigo (copiado de routes/bank_import.exportar_contabil antes do
+# streaming; so a parte depois das consultas)
+# ---------------------------------------------------------------------------
+
+def _export_sort_key(r):
+    d = r.get('data_transacao') or r.get('data_venda') or r.get('data_recebimento')
+    return d if d else dt.date.min
+
+
+def _contas(r, m):
+    return B._resolver_contas_contabeis(r, m['despesa'], m['coligada'], m['fornecedor'], m['cnpj'],
+                                        troco_pix_conta_map=m['troco_pix'])
+
+
+def antigo_csv(rows, card_sale_rows, card_fee_rows, m):
+    out = io.StringIO()
+    w = csv.writer(out, delimiter=';')
+    w.writerow(['DATA', 'DESCRIÇÃO', 'VALOR',
+                'Nº CONTA CRÉDITO', 'DESCRIÇÃO CONTA CRÉDITO',
+                'Nº CONTA DÉBITO',  'DESCRIÇÃO CONTA DÉBITO'])
+    csv_rows_bank = [dict(r, _kind='bank') for r in rows]
+    csv_rows_card = [dict(r, _kind='card') for r in card_sale_rows]
+    csv_rows_fee  = [dict(r, _kind='fee')  for r in card_fee_rows]
+    for r in sorted(csv_rows_bank + csv_rows_card + csv_rows_fee, key=_export_sort_key):
+        if r['_kind'] == 'card':
+            d = r['data_venda']
+            w.writerow([d.strftime('%d/%m/%Y') if d else '',
+                        f"VENDA CARTÃO {r['tipo_cartao']} – {r['bandeira_nome']} ({r['empresa_nome']})",
+                        str(r['total_venda']).replace('.', ','),
+                        r['credito_cod'], r['credito_nome'], r['debito_cod'], r['debito_nome']])
+        elif r['_kind'] == 'fee':
+            d = r['data_recebimento']
+            w.writerow([d.strftime('%d/%m/%Y') if d else '',
+                        f"TAXA CARTÃO {r['tipo_cartao']} – {r['bandeira_nome']} ({r['empresa_nome']})",
+                        str(r['cycle_fee']).replace('.', ','),
+                        r['credito_cod'], r['credito_nome'], r['debito_cod'], r['debito_nome']])
+        else:
+            debito_cod, debito_nome, credito_cod, credito_nome = _contas(r, m)
+            valor = r['valor']
+            w.writerow([r['data_transacao'].strftime('%d/%m/%Y') if r['data_transacao'] else '',
+                        r['descricao'] or '',
+                        str(valor).replace('.', ',') if valor is not None else '',
+                        credito_cod, credito_nome, debito_cod, debito_nome])
+    out.seek(0)
+    return ('\ufeff' + out.getvalue()).encode('utf-8')
+
+
+def antigo_xlsx(rows, card_sale_rows, card_fee_rows, m):
+    from openpyxl.styles import Font, PatternFill, Alignment
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = 'Exportação Contábil'
+    header_fill = PatternFill(start_color='1D63A5', end_color='1D63A5', fill_type='solid')
+    header_font = Font(color='FFFFFF', bold=True, size=10)
+    header_align = Alignment(horizontal='center', vertical='center', wrap_text=True)
+    headers = ['DATA', 'DESCRIÇÃO', 'VALOR',
+               'Nº CONTA CRÉDITO', 'DESCRIÇÃO CONTA CRÉDITO',
+               'Nº CONTA DÉBITO',  'DESCRIÇÃO CONTA DÉBITO']
+    col_widths = [12, 55, 14, 18, 32, 18, 32]
+    for col_idx, (h, w) in enumerate(zip(headers, col_widths), start=1):
+        cell = ws.cell(row=1, column=col_idx, value=h)
+        cell.fill = header_fill
+        cell.font = header_font
+        cell.alignment = header_align
+        ws.column_dimensions[cell.column_letter].width = w
+    ws.row_dimensions[1].height = 20
+    ws.freeze_panes = 'A2'
+    ws.auto_filter.ref = f'A1:{ws.cell(row=1, column=len(headers)).column_letter}1'
+    warn_fill  = PatternFill(start_color='FFFF00', end_color='FFFF00', fill_type='solid')
+    card_fill  = PatternFill(start_color='E8F5E9', end_color='E8F5E9', fill_type='solid')
+    fee_fill   = PatternFill(start_color='FFF3E0', end_color='FFF3E0', fill_type='solid')
+    money_fmt  = '#,##0.00'
+    all_export_rows = []
+    for r in rows:
+        r['_kind'] = 'bank'
+        all_export_rows.append(r)
+    for r in card_sale_rows:
+        r['_kind'] = 'card'
+        all_export_rows.append(r)
+    for r in card_fee_rows:
+        r['_kind'] = 'fee'
+        all_export_rows.append(r)
+    all_export_rows.sort(key=_export_sort_key)
+    _warn_accounts = []
+    for row_idx, r in enumerate(all_export_rows, start=2):
+        if r['_kind'] in ('card', 'fee'):
+            card = r['_kind'] == 'card'
+            d = r['data_venda'] if card else r['data_recebimento']
+            descr = (f"{'VENDA' if card else 'TAXA'} CARTÃO {r['tipo_cartao']} – "
+                     f"{r['bandeira_nome']} ({r['empresa_nome']})")
+            ws.cell(row=row_idx, column=1, value=d.strftime('%d/%m/%Y') if d else '')
+            ws.cell(row=row_idx, column=2, value=descr)
+            val_cell = ws.cell(row=row_idx, column=3, value=r['total_venda'] if card else r['cycle_fee'])
+            val_cell.number_format = money_fmt
+            ws.cell(row=row_idx, column=4, value=r['credito_cod'])
+            ws.cell(row=row_idx, column=5, value=r['credito_nome'])
+            ws.cell(row=row_idx, column=6, value=r['debito_cod'])
+            ws.cell(row=row_idx, column=7, value=r['debito_nome'])
+            for col in range(1, 8):
+                ws.cell(row=row_idx, column=col).fill = card_fill if card else fee_fill
+        else:
+            debito_cod, debito_nome, credito_cod, credito_nome = _contas(r, m)
+            valor = r['valor']
+            ws.cell(row=row_idx, column=1,
+                    value=r['data_transacao'].strftime('%d/%m/%Y') if r['data_transacao'] else '')
+            ws.cell(row=row_idx, column=2, value=r['descricao'] or '')
+            val_cell = ws.cell(row=row_idx, column=3, value=float(valor) if valor is not None else 0)
+            val_cell.number_format = money_fmt
+            ws.cell(row=row_idx, column=4, value=credito_cod)
+            ws.cell(row=row_idx, column=5, value=credito_nome)
+            ws.cell(row=row_idx, column=6, value=debito_cod)
+            ws.cell(row=row_idx, column=7, value=debito_nome)
+            missing_credito = not credito_cod
+            missing_debito  = not debito_cod
+            if missing_credito or missing_debito:
+                for col in range(1, 8):
+                    ws.cell(row=row_idx, column=col).fill = warn_fill
+                tipo_conc = (r.get('tipo_conciliacao') or '').lower()
+                if 'transferen' in tipo_conc:
+                    if missing_debito:
+                        dest_banco = r.get('conta_destino_banco_nome') or ''
+                        if dest_banco:
+                            _warn_accounts.append((r.get('conta_apelido') or r.get('banco_nome') or '',
+                                                   dest_banco,
+                                                   'Conta destino sem Conta Contábil configurada'))
+                    if missing_credito:
+                        _warn_accounts.append((r.get('conta_apelido') or r.get('banco_nome') or '', '',
+                                               'Conta bancária sem Conta Contábil configurada'))
+    if _warn_accounts:
+        ws_warn = wb.create_sheet(title='⚠ Contas sem config')
+        warn_hdr_fill = PatternFill(start_color='FF6600', end_color='FF6600', fill_type='solid')
+        warn_hdr_font = Font(color='FFFFFF', bold=True, size=10)
+        for ci, (h, w) in enumerate(zip(['CONTA BANCÁRIA (ORIGEM)', 'CONTA BANCÁRIA (DESTINO)', 'PROBLEMA'],
+                                        [35, 35, 55]), start=1):
+            cell = ws_warn.cell(row=1, column=ci, value=h)
+            cell.fill = warn_hdr_fill
+            cell.font = warn_hdr_font
+            ws_warn.column_dimensions[cell.column_letter].width = w
+        seen_warn = set()
+        for item in _warn_accounts:
+            if item[:2] not in seen_warn:
+                seen_warn.add(item[:2])
+                for ci, val in enumerate(item, start=1):
+                    ws_warn.cell(row=len(seen_warn) + 1, column=ci, value=val)
+        instr_cell = ws_warn.cell(
+            row=len(seen_warn) + 3, column=1,
+            value='Para corrigir: acesse Banco → Gerenciar Contas → edite cada conta e selecione a Conta do Plano de Contas correspondente.')
+        instr_cell.font = Font(italic=True, color='666666')
+    buf = io.BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
+
+
+# ---------------------------------------------------------------------------
+
+def novo_csv(n, m):
+    return B._contabil_csv(B._contabil_registros([transacoes(n), vendas(), taxas()], Resolvedor(m)))
+
+
+def novo_xlsx(n, m, destino):
+    B._contabil_xlsx(B._contabil_registros([transacoes(n), vendas(), taxas()], Resolvedor(m)), destino)
+
+
+def medir(fn):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    try:
+        r = fn()
+        seg = time.perf_counter() - t0
+        pico = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return r, seg, pico
+
+
+def _mb(b):
+    return f"{b / 1e6:8.1f} MB"
+
+
+def _celulas(arquivo):
+    wb = openpyxl.load_workbook(arquivo)
+    out = {}
+    for ws in wb.worksheets:
+        out[ws.title] = (
+            [[(c.value if c.value != '' else None, c.fill.fgColor.rgb if c.fill.fill_type else None,
+               c.number_format, bool(c.font.b), bool(c.font.i)) for c in linha] for linha in ws.iter_rows()],
+            {k: d.width for k, d in ws.column_dimensions.items()},
+            ws.freeze_panes, ws.auto_filter.ref)
+    return out
+
+
+def comparar(n, m):
+    print(f"antigo x novo com {n} transacoes (tempos com tracemalloc ligado):")
+    antigo, s1, p1 = medir(lambda: antigo_csv(list(transacoes(n)), list(vendas()), list(taxas()), m))
+    novo, s2, p2 = medir(lambda: b''.join(novo_csv(n, m)))
+    assert antigo == novo, "CSV diferente"
+    print(f"  csv  antigo {s1:6.2f}s {_mb(p1)}   novo {s2:6.2f}s {_mb(p2)}   identico ({len(novo)} bytes)")
+    antigo, s1, p1 = medir(lambda: antigo_xlsx(list(transacoes(n)), list(vendas()), list(taxas()), m))
+    with tempfile.TemporaryFile() as f:
+        _, s2, p2 = medir(lambda: novo_xlsx(n, m, f))
+        f.seek(0)
+        a, b = _celulas(io.BytesIO(antigo)), _celulas(f)
+    assert a == b, "XLSX diferente"
+    avisos = len(a.get('⚠ Contas sem config', ([],))[0])
+    print(f"  xlsx antigo {s1:6.2f}s {_mb(p1)}   novo {s2:6.2f}s {_mb(p2)}"
+          f"   mesmas celulas, estilos e aba de avisos ({avisos} linhas)")
+
+
+def _csv(n, m):
+    return sum(len(p) for p in novo_csv(n, m))
+
+
+def _xlsx(n, m):
+    with tempfile.TemporaryFile() as f:
+        novo_xlsx(n, m, f)
+        return f.seek(0, os.SEEK_END)
+
+
+def constante(rotulo, fn, n, m):
+    """Pico de memoria com n/10 e com n transacoes: tem de ser o mesmo."""
+    picos = []
+    for k in (max(n // 10, 1), n):
+        tam, seg, pico = medir(lambda: fn(k, m))
+        picos.append(pico)
+        print(f"  {rotulo} {k:>9} transacoes {seg:7.1f}s {_mb(pico)}   ({tam / 1e6:.0f} MB gerados)")
+    assert picos[1] <= picos[0] * 1.5 + 2e6, "memoria cresceu com o numero de linhas"
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('n', nargs='?', type=int, default=1_000_000)
+    ap.add_argument('--comparar', type=int, default=5_000)
+    ap.add_argument('--xlsx', type=int, default=50_000,
+                    help='transacoes no teste de memoria do Excel (0 pula)')
+    args = ap.parse_args()
+    m = mapas()
+    comparar(args.comparar, m)
+    print("caminho novo, pico de memoria (tracemalloc):")
+    constante('csv ', _csv, args.n, m)
+    if args.xlsx:
+        constante('xlsx', _xlsx, args.xlsx, m)
+    print(f"OK: {args.n} transacoes exportadas com memoria constante")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""Benchmark do motor FIFO: listas + pop(0) (calculo antigo) x deque.
+
+Sem banco e sem Flask. Gera N movimentos sinteticos (compras no formato de
+fretes e vendas diarias no formato de vendas_posto, valores Decimal como vem
+do MySQL), roda o calculo antigo e `utils.fifo.calcular` nos dois modos
+(Decimal e float), confere que os resultados sao identicos e imprime os
+tempos.
+
+O pior caso do calculo antigo e muitas camadas pequenas vivas ao mesmo tempo:
+cada pop(0) desloca a lista inteira. O cenario "estoque alto" simula isso
+(muitas compras antes de cada venda grande).
+
+Uso:
+    python scripts/bench_fifo.py [n_movimentos]
+"""
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.fifo import calcular  # noqa: E402
+
+
+# ---------------------------------------------------------------------------
+# Semântica de referência (listas + pop(0)): o motor antigo, para o benchmark
+# e para o teste de equivalência (test_fifo.py).
+# ---------------------------------------------------------------------------
+
+def _calcular_lista(camadas_iniciais, compras, vendas, exato=True):
+    """O cálculo antigo (`_calcular_fifo` / `_calcular_fifo_relatorio`)."""
+    from collections import defaultdict
+    if exato:
+        num, tol, zero = (lambda v: Decimal(str(v))), Decimal('0.001'), Decimal('0')
+    else:
+        num, tol, zero = float, 0.001, 0.0
+
+    layers = [{'qtde': num(c['qtde']), 'custo': num(c['custo'])}
+              for c in camadas_iniciais if float(c.get('qtde', 0)) > 0]
+    qtde_entrada = custo_entrada = qtde_saida = receita = cogs = zero
+
+    comp_by_date = defaultdict(list)
+    for c in sorted(compras, key=lambda x: x['data']):
+        comp_by_date[c['data']].append(c)
+    vend_by_date = defaultdict(list)
+    for v in sorted(vendas, key=lambda x: x['data']):
+        vend_by_date[v['data']].append(v)
+
+    for data in sorted(set(list(comp_by_date.keys()) + list(vend_by_date.keys()))):
+        for comp in comp_by_date.get(data, []):
+            qtde = num(comp['qtde'])
+            custo = num(comp['custo'])
+            if qtde > 0:
+                layers.append({'qtde': qtde, 'custo': custo})
+                qtde_entrada += qtde
+                custo_entrada += qtde * custo
+        for vend in vend_by_date.get(data, []):
+            qtde_vender = num(vend['qtde'])
+            valor = num(vend['valor_total'])
+            if qtde_vender <= 0:
+                continue
+            qtde_saida += qtde_vender
+            receita += valor
+            restante = qtde_vender
+            while restante > tol and layers:
+                layer = layers[0]
+                if layer['qtde'] <= restante + tol:
+                    cogs += layer['qtde'] * layer['custo']
+                    restante -= layer['qtde']
+                    layers.pop(0)
+                else:
+                    cogs += restante * layer['custo']
+                    layer['qtde'] -= restante
+                    restante = zero
+
+    estoque_final_qtde = sum(l['qtde'] for l in layers)
+    estoque_final_valor = sum(l['qtde'] * l['custo'] for l in layers)
+    resultado = {
+        'qtde_entrada': float(qtde_entrada),
+        'custo_entrada_total': float(custo_entrada),
+        'custo_entrada_unit': float(custo_entrada / qtde_entrada) if qtde_entrada > 0 else 0.0,
+        'qtde_saida': float(qtde_saida),
+        'receita_saida': float(receita),
+        'preco_medio_saida': float(receita / qtde_saida) if qtde_saida > 0 else 0.0,
+        'cogs': float(cogs),
+        'lucro': float(receita - cogs),
+        'estoque_final_qtde': float(estoque_final_qtde),
+        'estoque_final_valor': float(estoque_final_valor),
+        'estoque_final_custo_unit': float(estoque_final_valor / estoque_final_qtde) if estoque_final_qtde > 0 else 0.0,
+    }
+    return resultado, layers
+
+
+def _avancar_lista(layers, compras, vendas_por_data):
+    """O avanço antigo (`_advance_layers_to_date` + `_consumir_fifo`), em float."""
+    from collections import defaultdict
+    compras_by_date = defaultdict(list)
+    for row in compras:
+        compras_by_date[row['data']].append({'qtde': float(row['qtde']), 'custo': float(row['custo'])})
+    for d in sorted(set(list(compras_by_date.keys()) + list(vendas_por_data.keys()))):
+        for comp in compras_by_date.get(d, []):
+            if comp['qtde'] > 0 and comp['custo'] > 0:
+                layers.append({'qtde': comp['qtde'], 'custo': comp['custo']})
+        restante = vendas_por_data.get(d, 0.0)
+        while restante > 0.001 and layers:
+            camada = layers[0]
+            if camada['qtde'] <= restante + 0.001:
+                restante -= camada['qtde']
+                layers.pop(0)
+            else:
+                camada['qtde'] -= restante
+                restante = 0.0
+
+
+def gerar(n, compras_por_venda, seed=42):
+    rnd = random.Random(seed)
+    compras, vendas = [], []
+    d = date(2020, 1, 1)
+    while len(compras) + len(vendas) < n:
+        for _ in range(compras_por_venda):
+            compras.append({
+                'data': d,
+                'qtde': Decimal('%.3f' % rnd.uniform(50, 500)),
+                'custo': Decimal('%.4f' % rnd.uniform(4.5, 6.5)),
+            })
+        qtde = Decimal('%.3f' % (rnd.uniform(0.8, 1.0) * 275 * compras_por_venda))
+        vendas.append({'data': d, 'qtde': qtde,
+                       'valor_total': (qtde * Decimal('6.19')).quantize(Decimal('0.01'))})
+        d += timedelta(days=1)
+    return compras, vendas
+
+
+def _tempo(fn, *args, **kw):
+    t0 = time.perf_counter()
+    r = fn(*args, **kw)
+    return time.perf_counter() - t0, r
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    for nome, cpv, iniciais in (
+        ('giro normal', 2, [{'qtde': 5000, 'custo': 5.1}]),
+        ('estoque alto', 50, [{'qtde': Decimal('120.000'), 'custo': Decimal('5.1')}] * 20_000),
+    ):
+        compras, vendas = gerar(n, cpv)
+        print(f'{nome}: {len(compras)} compras + {len(vendas)} vendas, '
+              f'{len(iniciais)} camadas iniciais')
+        for exato in (True, False):
+            t_ant, r_ant = _tempo(_calcular_lista, iniciais, compras, vendas, exato=exato)
+            t_nov, r_nov = _tempo(calcular, iniciais, compras, vendas, exato=exato)
+            modo = 'Decimal' if exato else 'float  '
+            igual = 'identico' if r_ant == r_nov else 'DIVERGE'
+            print(f'  {modo}  antigo {t_ant:7.3f}s   deque {t_nov:7.3f}s   '
+                  f'({t_ant / t_nov:4.1f}x)  {igual}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""Benchmark do parser OFX em streaming (integrations.ofx_parser.iter_transactions).
+
+Sem banco e sem Flask. Gera um OFX SGML sintetico (por padrao 500 mil
+transacoes, ~100 MB) num arquivo temporario, le em streaming em lotes do mesmo
+tamanho que `_save_transactions_em_lotes` usa e mede tempo e pico de memoria
+(tracemalloc). Com --comparar, roda tambem o OFXParser em memoria, para ver o
+pico crescer com o arquivo.
+
+Uso:
+    python scripts/bench_ofx_stream.py [n_transacoes] [--comparar]
+"""
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from integrations.ofx_parser import OFXParser, iter_transactions  # noqa: E402
+
+LOTE = 2000  # o mesmo _OFX_LOTE de routes/bank_import.py
+
+CABECALHO = (
+    "OFXHEADER:100\r\nDATA:OFXSGML\r\nVERSION:102\r\nENCODING:USASCII\r\n\r\n"
+    "<OFX>\r\n<BANKMSGSRSV1>\r\n<STMTTRNRS>\r\n<STMTRS>\r\n<CURDEF>BRL\r\n"
+    "<BANKACCTFROM>\r\n<BANKID>0341\r\n<ACCTID>123456\r\n</BANKACCTFROM>\r\n"
+    "<BANKTRANLIST>\r\n<DTSTART>20240101\r\n<DTEND>20251231\r\n"
+)
+RODAPE = "</BANKTRANLIST>\r\n</STMTRS>\r\n</STMTTRNRS>\r\n</BANKMSGSRSV1>\r\n</OFX>\r\n"
+
+
+def gerar(caminho, n):
+    with open(caminho, 'w', encoding='latin-1', newline='') as fh:
+        fh.write(CABECALHO)
+        for i in range(n):
+            dia = 1 + i % 28
+            mes = 1 + (i // 28) % 12
+            fh.write(
+                "<STMTTRN>\r\n"
+                f"<TRNTYPE>{'DEBIT' if i % 3 else 'CREDIT'}\r\n"
+                f"<DTPOSTED>2025{mes:02d}{dia:02d}100000[-3:BRT]\r\n"
+                f"<TRNAMT>{'-' if i % 3 else ''}{(i % 9973) + 0.37:.2f}\r\n"
+                f"<FITID>{i:012d}\r\n"
+                f"<NAME>PIX ENVIADO POSTO {i % 500:03d} 12.345.678/0001-95\r\n"
+                f"<MEMO>LOTE {i // LOTE}\r\n"
+                "</STMTTRN>\r\n"
+            )
+        fh.write(RODAPE)
+
+
+def medir(rotulo, fn):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    n = fn()
+    dt = time.perf_counter() - t0
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'  {rotulo:<22} {n:>8} tx  {dt:7.2f} s  pico {pico / 2**20:8.1f} MiB')
+    return n
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    n = int(args[0]) if args else 500_000
+    comparar = '--comparar' in sys.argv
+
+    with tempfile.TemporaryDirectory() as tmp:
+        caminho = os.path.join(tmp, 'extrato.ofx')
+        gerar(caminho, n)
+        print(f'{n} transacoes, arquivo de {os.path.getsize(caminho) / 2**20:.1f} MiB')
+
+        def streaming():
+            total = 0
+            lote = []
+            with open(caminho, 'rb') as fh:
+                for tx in iter_transactions(fh):
+                    lote.append(tx)
+                    if len(lote) >= LOTE:
+                        total += len(lote)
+                        lote.clear()
+            return total + len(lote)
+
+        def em_memoria():
+            with open(caminho, 'r', encoding='latin-1', errors='replace') as fh:
+                return len(OFXParser(fh.read()).get_transactions())
+
+        ok = medir('streaming (lotes)', streaming) == n
+        if comparar:
+            ok = medir('OFXParser em memoria', em_memoria) == n and ok
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""Benchmark do casamento de regras de conciliacao: laco antigo x indice.
+
+Sem banco e sem Flask. Gera 1k regras e 10k transacoes sinteticas no formato
+das linhas de bank_conciliacao_regras / bank_transactions, roda o laco
+regra-a-regra (a semantica antiga de `_auto_conciliar_por_regras`) e o
+`IndiceRegras`, confere que os dois escolhem a MESMA regra para todas as
+transacoes e imprime os tempos.
+
+Uso:
+    python scripts/bench_regras_conciliacao.py [n_transacoes] [n_regras]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.regras_conciliacao import IndiceRegras  # noqa: E402
+
+PALAVRAS = [
+    'PIX', 'TED', 'DOC', 'DEP', 'DINHEIRO', 'TARIFA', 'BOLETO', 'LIQ',
+    'COBRANCA', 'SIMPLES', 'POSTO', 'SHELL', 'IPIRANGA', 'RAIZEN', 'VIBRA',
+    'TRANSPORTES', 'TREMEA', 'CIELO', 'REDE', 'STONE', 'GETNET', 'DEB',
+    'AUTOMATICO', 'ENVIADO', 'RECEBIDO', 'PAGAMENTO', 'FORNECEDOR', 'IOF',
+]
+
+
+def _primeira_regra_linear(regras, descricao, tipo, account_id):
+    """Semântica de referência: o laço antigo, regra a regra.
+
+    Fica aqui, fora de utils, para o benchmark e para os testes de
+    equivalência (test_regras_conciliacao.py); o caminho de produção é
+    `IndiceRegras.primeira`.
+    """
+    descricao = (descricao or '').upper()
+    tipo = tipo or ''
+    for pos, regra in enumerate(regras):
+        regra_account_id = regra.get('account_id')
+        if regra_account_id and int(regra_account_id) != int(account_id):
+            continue
+        tipo_regra = regra.get('tipo_transacao', 'AMBOS')
+        if tipo_regra != 'AMBOS' and tipo_regra != tipo:
+            continue
+        padrao = (regra.get('padrao_descricao') or '').upper()
+        if regra.get('tipo_match', 'contem') == 'exato':
+            match = descricao == padrao
+        else:
+            match = padrao in descricao
+        if not match:
+            continue
+        padrao2 = (regra.get('padrao_secundario') or '').upper()
+        if padrao2 and padrao2 not in descricao:
+            continue
+        return pos
+    return None
+
+
+def gerar(n_tx, n_regras, seed=42):
+    rnd = random.Random(seed)
+    regras = []
+    for rid in range(1, n_regras + 1):
+        padrao = ' '.join(rnd.sample(PALAVRAS, rnd.randint(1, 2)))
+        if rnd.random() < 0.5:
+            padrao += ' %05d' % rnd.randint(0, 99999)
+        regras.append({
+            'id': rid,
+            'padrao_descricao': padrao.lower(),
+            'padrao_secundario': rnd.choice(PALAVRAS) if rnd.random() < 0.2 else None,
+            'tipo_match': 'exato' if rnd.random() < 0.1 else 'contem',
+            'tipo_transacao': rnd.choice(['AMBOS', 'CREDIT', 'DEBIT']),
+            'account_id': rnd.randint(1, 8) if rnd.random() < 0.3 else None,
+        })
+    # mesma ORDER BY da query de producao
+    regras.sort(key=lambda r: (
+        r['account_id'] is None, not r['padrao_secundario'], r['id']))
+
+    txs = []
+    for i in range(n_tx):
+        if rnd.random() < 0.3:
+            desc = rnd.choice(regras)['padrao_descricao']
+        else:
+            desc = ' '.join(rnd.choice(PALAVRAS) for _ in range(rnd.randint(2, 6)))
+        desc += ' %05d' % rnd.randint(0, 99999)
+        txs.append((desc, rnd.choice(['CREDIT', 'DEBIT']), rnd.randint(1, 8)))
+    return regras, txs
+
+
+def main():
+    n_tx = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    n_regras = int(sys.argv[2]) if len(sys.argv) > 2 else 1_000
+    regras, txs = gerar(n_tx, n_regras)
+    print(f'{n_tx} transacoes x {n_regras} regras')
+
+    t0 = time.perf_counter()
+    antigo = [_primeira_regra_linear(regras, d, t, a) for d, t, a in txs]
+    t_antigo = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    indice = IndiceRegras(regras)
+    t_build = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    novo = [indice.primeira(d, t, a) for d, t, a in txs]
+    t_novo = time.perf_counter() - t0
+
+    divergencias = sum(1 for a, b in zip(antigo, novo) if a != b)
+    casadas = sum(1 for a in novo if a is not None)
+    print(f'  laco antigo : {t_antigo:8.3f} s')
+    print(f'  indice build: {t_build:8.3f} s (uma vez por versao das regras)')
+    print(f'  indice match: {t_novo:8.3f} s  ({t_antigo / max(t_novo, 1e-9):.0f}x)')
+    print(f'  casadas: {casadas}  divergencias: {divergencias}')
+    return 1 if divergencias else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
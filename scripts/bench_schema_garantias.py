@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""Quanto as garantias de schema (_ensure_* / _garante_*) custavam por request.
+
+Antes de utils/schema_registry.py cada handler chamava as suas -- consulta no
+information_schema, CREATE TABLE IF NOT EXISTS -- em TODA request; a maioria
+nao tinha flag nenhuma. Agora rodam uma vez na partida e a chamada no handler
+so checa um atributo em memoria.
+
+Banco real (precisa DB_PASSWORD). Para cada garantia registrada mede a funcao
+ORIGINAL (o que a request pagava) e a decorada ja pronta (o que paga agora);
+depois soma por pagina, com as garantias que cada handler chama.
+
+As garantias sao idempotentes: num banco ja migrado nao alteram nada. As de
+persistir=False (reparo de dados, ex. lancamentos_funcionarios) ficam de fora.
+
+Uso:
+    $env:DB_PASSWORD = "<senha>"
+    python scripts/bench_schema_garantias.py [repeticoes]
+"""
+import importlib
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('SECRET_KEY', 'bench-schema')
+
+from utils.db import get_db_connection  # noqa: E402
+from utils.db_credentials import exigir_senha  # noqa: E402
+from utils import schema_registry  # noqa: E402
+
+MODULOS = (
+    'routes.bank_import', 'routes.conf_cartoes', 'routes.conf_fornecedores_dfe',
+    'routes.conf_depositos', 'routes.depositos', 'routes.motoristas', 'routes.fretes',
+    'routes.lancamentos_caixa', 'routes.lancamentos_funcionarios',
+)
+
+# handler -> garantias que ele chamava no comeco de toda request
+PAGINAS = {
+    'bank_import.exportar_contabil': (
+        'routes.bank_import._ensure_bank_accounts_coligadas',
+        'routes.bank_import._ensure_bank_account_coligadas_table',
+        'routes.bank_import._ensure_bt_conta_origem_id',
+        'routes.bank_import._ensure_bt_conta_destino_id'),
+    'conf_cartoes.conf_cartoes': (
+        'routes.conf_cartoes._ensure_vinculos_table',
+        'routes.conf_cartoes._ensure_feriados_table',
+        'routes.conf_cartoes._ensure_conta_contabil_table'),
+    'conf_fornecedores_dfe.conf_fornecedores_dfe': (
+        'routes.conf_fornecedores_dfe._garante_tabela_grupo',
+        'routes.conf_fornecedores_dfe._garante_coluna_manual',
+        'routes.conf_fornecedores_dfe._garante_coluna_pago_antes',
+        'routes.conf_fornecedores_dfe._garante_tabela_pg_pre_corte',
+        'routes.conf_fornecedores_dfe._garante_tabela_nota_lanc',
+        'routes.conf_fornecedores_dfe._garante_tabela_vinculo'),
+    'conf_depositos.conf_depositos': ('routes.conf_depositos._ensure_vinculos_table',),
+    'motoristas.lista': ('routes.motoristas._ensure_veiculo_id',),
+}
+
+
+def _medir(fn, g, repeticoes):
+    tempos = []
+    for _ in range(repeticoes):
+        conn = get_db_connection()
+        try:
+            t0 = time.perf_counter()
+            fn(conn) if g.com_conn else fn()
+            tempos.append((time.perf_counter() - t0) * 1000)
+        finally:
+            conn.close()
+    return statistics.median(tempos)
+
+
+def main():
+    exigir_senha()
+    repeticoes = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    for m in MODULOS:
+        importlib.import_module(m)
+
+    print('%-62s %10s %10s' % ('garantia', 'antes ms', 'agora ms'))
+    custo = {}
+    for nome, g in schema_registry._REGISTRO.items():
+        if not g.persistir:
+            print('%-62s %10s' % (nome, 'reparo'))
+            continue
+        antes = _medir(g.fn, g, repeticoes)
+        g.pronta = True
+        agora = _medir(g.rodar, g, repeticoes)
+        custo[nome] = (antes, agora)
+        print('%-62s %10.2f %10.4f' % (nome, antes, agora))
+
+    print('\n%-46s %4s %12s %12s' % ('pagina', 'n', 'antes ms/req', 'agora ms/req'))
+    for pagina, nomes in PAGINAS.items():
+        antes = sum(custo[n][0] for n in nomes if n in custo)
+        agora = sum(custo[n][1] for n in nomes if n in custo)
+        print('%-46s %4d %12.2f %12.4f' % (pagina, len(nomes), antes, agora))
+
+
+if __name__ == '__main__':
+    main()
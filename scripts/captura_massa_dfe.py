@@ -19,12 +19,21 @@
 #
 #  Idempotente (UNIQUE na chave): rodar de novo NUNCA duplica. Se parar por 656,
 #  espere ~1h e rode de novo -- ele continua de onde parou (ult_nsu).
+#
+#  Multi-empresa EM PARALELO: cada empresa/certificado e uma "lane" num pool
+#  limitado (DFE_CAPTURA_PARALELO). Cada lane tem a PROPRIA sessao mTLS, as
+#  PROPRIAS conexoes pymysql e o PROPRIO castigo de 656 (dfe_nsu/dfe_nsu_cte
+#  sao por cliente_id). Um teto global (DFE_SEFAZ_SIMULTANEAS) limita quantas
+#  requisicoes ficam em voo na SEFAZ ao mesmo tempo, somando todas as lanes.
 # ============================================================================
+import io
 import os
 import sys
 import time
 import gzip
 import base64
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import xml.etree.ElementTree as ET
 from datetime import datetime, timedelta
 
@@ -59,6 +68,18 @@ MAX_LOTES_CTE = 15    # teto MENOR da Fase B (CT-e): a 1a consulta vem cheia (at
                       # meses de historico) e nao pode estourar o timeout de 20 min
                       # do subprocess; o resto vem nas proximas rodadas.
 
+# Paralelismo entre empresas. Lanes = empresas processadas ao mesmo tempo (cada
+# uma com sessao/conexoes proprias). SIMULTANEAS = teto GLOBAL de requisicoes
+# distDFeInt em voo, somando as lanes (default: igual ao numero de lanes).
+# DFE_CAPTURA_PARALELO=1 volta ao comportamento sequencial de antes.
+MAX_PARALELO = max(1, int(os.environ.get("DFE_CAPTURA_PARALELO", "4")))
+MAX_SEFAZ_SIMULTANEAS = max(1, int(os.environ.get("DFE_SEFAZ_SIMULTANEAS",
+                                                  str(MAX_PARALELO))))
+_sefaz_vagas = threading.BoundedSemaphore(MAX_SEFAZ_SIMULTANEAS)
+
+# Folga, depois do prazo da captura, para o ultimo esvaziamento do spool de XML.
+FOLGA_UPLOAD_SEG = int(os.environ.get("DFE_XML_UPLOAD_FOLGA_SEG", "120"))
+
 # Quem disparou esta rodada. O agendador injeta DFE_ORIGEM no subprocess
 # ('agendador' ou 'manual'); rodando na mao pelo terminal fica 'cli'. So rotula
 # o log -- nao muda nenhum comportamento da captura.
@@ -98,8 +119,9 @@ def _consultar(sess, cnpj_cert, ult_nsu):
         ),
         "User-Agent": "nh-transportes/captura-massa-dfe (loop)",
     }
-    r = sess.post(cs.ENDPOINT, data=soap.encode("utf-8"), headers=headers,
-                  timeout=cs.TIMEOUT)
+    with _sefaz_vagas:   # teto global entre lanes
+        r = sess.post(cs.ENDPOINT, data=soap.encode("utf-8"), headers=headers,
+                      timeout=cs.TIMEOUT)
     if r.status_code != 200:
         cs.falhar("HTTP != 200", f"status {r.status_code}")
     env = ET.fromstring(r.content)
@@ -109,15 +131,22 @@ def _consultar(sess, cnpj_cert, ult_nsu):
     return ret, len(r.content)
 
 
+# De-para cod_anp -> produto_id da RODADA inteira (todas as empresas e lotes).
+# Compartilhado entre as lanes: so cresce, e um codigo resolvido duas vezes ao
+# mesmo tempo da o mesmo produto_id.
+_DEPARA = pd.DeparaAnp()
+
+
 # ==========================================================================
 # Processa os docZip de UMA resposta 138. Mesmo dispatch de processa_dfe.main(),
-# chamando as funcoes IMPORTADAS de processa_dfe (extrai/grava/Dropbox).
-# Grava por documento (commit/rollback dentro de gravar_*). Retorna contagens.
+# chamando o pipeline IMPORTADO de processa_dfe (pd.processar_lote: decode ->
+# parse -> Dropbox -> INSERTs em bloco, com volta ao doc a doc se o bloco
+# falhar). Retorna contagens.
 # ==========================================================================
 def _processar_docs(conn, cur, ret, cliente_id, cnpj_cert, agora, expira, ult_nsu):
     """Processa os docZip de UMA resposta 138, EM ORDEM DE NSU, avancando a
-    marca-d'agua (nsu_ok) so APOS cada gravacao bem-sucedida. Se um doc falha,
-    PARA na hora e devolve houve_falha=True: o chamador NAO deve avancar o
+    marca-d'agua (nsu_ok) so ate o ultimo doc gravado com sucesso. Se um doc
+    falha, PARA nele e devolve houve_falha=True: o chamador NAO deve avancar o
     ult_nsu alem de nsu_ok. Retorna (contagens, nsu_ok, houve_falha)."""
     lote = cs._find(ret, "loteDistDFeInt")
     docs = [e for e in (lote.iter() if lote is not None else [])
@@ -127,20 +156,10 @@ def _processar_docs(conn, cur, ret, cliente_id, cnpj_cert, agora, expira, ult_ns
              n_itens=0, n_cancel=0, n_cte=0, n_resumo_cte=0)
 
     nsu_ok = ult_nsu
-    houve_falha = False
-    for d in docs:
-        nsu = pd._to_int(d.get("NSU"))
-        try:
-            kind, ni, canc = pd.processar_um_doc(
-                conn, cur, cliente_id, cnpj_cert, d, agora, expira)
-        except Exception as exc:
-            conn.rollback()
-            houve_falha = True
-            print(f"      [NSU {nsu}] FALHA ao salvar: {exc}")
-            print(f"      >>> PARANDO o lote; ult_nsu nao avanca alem de {nsu_ok} "
-                  "(retenta no proximo ciclo).")
-            break
-
+    tempos = {}
+    resultados, erro = pd.processar_lote(conn, cur, cliente_id, cnpj_cert, docs,
+                                         agora, expira, _DEPARA, tempos)
+    for nsu, kind, ni, canc in resultados:
         if kind == "nota":
             c["n_nota"] += 1
             c["n_itens"] += ni
@@ -161,6 +180,14 @@ def _processar_docs(conn, cur, ret, cliente_id, cnpj_cert, agora, expira, ult_ns
 
         nsu_ok = nsu   # so avanca a marca APOS salvar com sucesso
 
+    houve_falha = erro is not None
+    if houve_falha:
+        print(f"      [NSU {erro[0]}] FALHA ao salvar: {erro[1]}")
+        print(f"      >>> PARANDO o lote; ult_nsu nao avanca alem de {nsu_ok} "
+              "(retenta no proximo ciclo).")
+    if docs:
+        print(f"      tempos ({len(docs)} docs): {pd.formatar_tempos(tempos)}")
+
     return c, nsu_ok, houve_falha
 
 
@@ -175,8 +202,9 @@ def _consultar_cte(sess, cnpj_cert, ult_nsu):
         ),
         "User-Agent": "nh-transportes/captura-massa-cte (loop)",
     }
-    r = sess.post(cte.ENDPOINT_CTE, data=soap.encode("utf-8"), headers=headers,
-                  timeout=cs.TIMEOUT)
+    with _sefaz_vagas:   # teto global entre lanes
+        r = sess.post(cte.ENDPOINT_CTE, data=soap.encode("utf-8"), headers=headers,
+                      timeout=cs.TIMEOUT)
     if r.status_code != 200:
         cs.falhar("HTTP != 200 (CTe)", f"status {r.status_code}")
     env = ET.fromstring(r.content)
@@ -522,13 +550,112 @@ def capturar_nfe(sess, cliente_id, cnpj_cert, prazo=None):
     print("=" * 74)
 
 
+# ==========================================================================
+# LANES - saida por empresa. Com varias empresas em paralelo os print() de uma
+# lane se misturariam com os das outras; cada lane escreve num buffer PROPRIO
+# (por thread) e o bloco inteiro vai para o stdout de uma vez quando ela acaba.
+# ==========================================================================
+class _SaidaPorLane(io.TextIOBase):
+    def __init__(self, original):
+        self.original = original
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def iniciar(self):
+        self._local.buf = io.StringIO()
+
+    def despejar(self):
+        buf = getattr(self._local, "buf", None)
+        self._local.buf = None
+        if buf is not None:
+            with self._lock:
+                self.original.write(buf.getvalue())
+                self.original.flush()
+
+    def write(self, texto):
+        buf = getattr(self._local, "buf", None)
+        if buf is not None:
+            return buf.write(texto)
+        with self._lock:
+            return self.original.write(texto)
+
+    def flush(self):
+        if getattr(self._local, "buf", None) is None:
+            self.original.flush()
+
+
+def _capturar_empresa(cliente_id, documento, cert, chave_priv, cadeia, prazo):
+    """UMA lane: Fase A (NF-e) + Fase B (CT-e) de UMA empresa, com sessao mTLS
+    propria. As conexoes pymysql ja sao abertas por fase/consulta (nada e
+    compartilhado entre lanes)."""
+    # Pre-check BARATO: se AMBAS as fases desta empresa estao de castigo por
+    # 656, pula sem montar sessao/consultar (cada fase re-checa por dentro).
+    nfe_bloq = pd.bloqueado_por_cota(cliente_id)
+    cte_bloq = cte.bloqueado_por_cota_cte(cliente_id)
+    if nfe_bloq and cte_bloq:
+        print(f"[empresa {documento}] NF-e e CT-e de castigo (656); pulando.")
+        _log_avulso(cliente_id, documento, 'pulado_cota',
+                    detalhe="loop multi: ambas as fases bloqueadas; nao consultou")
+        return
+
+    print(f"[empresa {documento}] cliente_id={cliente_id} -> Fase A + Fase B")
+    sess = cs.montar_sessao_mtls(cert, chave_priv, cadeia)
+    try:
+        capturar_nfe(sess, cliente_id, documento, prazo=prazo)
+        capturar_cte(sess, cliente_id, documento, prazo=prazo)
+    finally:
+        sess.close()
+
+
+def _rodar_lanes(certs, prazo, max_paralelo=MAX_PARALELO, capturar=_capturar_empresa):
+    """Roda `capturar(*cert, prazo)` para cada empresa num pool de ate
+    `max_paralelo` lanes, na ordem de prioridade de `certs` (mais atrasada
+    primeiro). Erro de uma empresa NAO derruba as outras -- inclusive o
+    SystemExit de cs.falhar(), que no laco sequencial matava a rodada inteira.
+    Retorna a lista de documentos (CNPJ) que abortaram por SystemExit."""
+    saida = sys.stdout if isinstance(sys.stdout, _SaidaPorLane) else None
+    falhas = []
+    falhas_lock = threading.Lock()
+
+    def _lane(reg):
+        cliente_id, documento = reg[0], reg[1]
+        if time.monotonic() > prazo:
+            print(f"[empresa {documento}] prazo suave atingido antes de comecar; "
+                  "vem no proximo ciclo.")
+            return
+        if saida is not None:
+            saida.iniciar()
+        try:
+            capturar(*reg, prazo)
+        except SystemExit as exc:
+            # cs.falhar(): a fase ja gravou o 'erro' da requisicao no log.
+            print(f"[empresa {documento}] ABORTOU (rc={exc.code}); seguindo com as demais.")
+            with falhas_lock:
+                falhas.append(documento)
+        except Exception as exc:
+            # Isola a falha nesta empresa; as demais continuam.
+            print(f"[empresa {documento}] FALHOU: {type(exc).__name__}: {exc}; seguindo.")
+            _log_avulso(cliente_id, documento, 'erro',
+                        detalhe=f"loop multi: {type(exc).__name__}: {exc}")
+        finally:
+            if saida is not None:
+                saida.despejar()
+
+    n = max(1, min(max_paralelo, len(certs)))
+    with ThreadPoolExecutor(max_workers=n, thread_name_prefix="dfe-lane") as pool:
+        for fut in [pool.submit(_lane, reg) for reg in certs]:
+            fut.result()
+    return falhas
+
+
 # ==========================================================================
 # MAIN - orquestrador MULTI-EMPRESA. Para CADA certificado ativo/automatico:
-# abre o cert (Dropbox), monta a sessao mTLS PROPRIA e roda Fase A (NF-e) + Fase
-# B (CT-e), cada uma com seu cursor/cota (isolados por cliente_id). Erro de uma
-# empresa NAO derruba as outras. Prazo suave (DFE_CAPTURA_PRAZO_SEG, default
-# 960s=16min) evita estourar o timeout do subprocess: o que nao coube volta no
-# proximo ciclo (cada cursor retoma de onde parou).
+# abre o cert (Dropbox) e entrega a empresa a uma lane do pool, que monta a
+# sessao mTLS PROPRIA e roda Fase A (NF-e) + Fase B (CT-e), cada uma com seu
+# cursor/cota (isolados por cliente_id). Erro de uma empresa NAO derruba as
+# outras. Prazo suave (DFE_CAPTURA_PRAZO_SEG, default 960s=16min) evita estourar
+# o timeout do subprocess: o que nao coube volta no proximo ciclo (cada cursor
+# retoma de onde parou).
 # ==========================================================================
 def main():
     print("=" * 74)
@@ -545,6 +672,7 @@ def main():
             c0.execute(pd.DDL_CTE_NFE)
             c0.execute(cte.DDL_NSU_CTE)
             dfe_log.garantir_tabela(c0)
+            pd.spool.garantir_tabela(c0)
         con0.commit()
     finally:
         con0.close()
@@ -554,36 +682,33 @@ def main():
     prazo = time.monotonic() + int(os.environ.get("DFE_CAPTURA_PRAZO_SEG", "960"))
 
     certs = cs.abrir_todos_certificados()
-    print(f"\n[1] {len(certs)} certificado(s) ativo(s)/automatico(s) a processar.\n")
+    print(f"\n[1] {len(certs)} certificado(s) ativo(s)/automatico(s) a processar "
+          f"({min(MAX_PARALELO, len(certs) or 1)} em paralelo, ate "
+          f"{MAX_SEFAZ_SIMULTANEAS} consulta(s) simultanea(s) na SEFAZ).\n")
 
-    for (cliente_id, documento, cert, chave_priv, cadeia) in certs:
-        if time.monotonic() > prazo:
-            print(">>> prazo suave atingido; empresas restantes vem no proximo ciclo.")
-            break
-
-        # Pre-check BARATO: se AMBAS as fases desta empresa estao de castigo por
-        # 656, pula sem montar sessao/consultar (cada fase re-checa por dentro).
-        nfe_bloq = pd.bloqueado_por_cota(cliente_id)
-        cte_bloq = cte.bloqueado_por_cota_cte(cliente_id)
-        if nfe_bloq and cte_bloq:
-            print(f"[empresa {documento}] NF-e e CT-e de castigo (656); pulando.")
-            _log_avulso(cliente_id, documento, 'pulado_cota',
-                        detalhe="loop multi: ambas as fases bloqueadas; nao consultou")
-            continue
-
-        print(f"[empresa {documento}] cliente_id={cliente_id} -> Fase A + Fase B")
-        try:
-            sess = cs.montar_sessao_mtls(cert, chave_priv, cadeia)
-            capturar_nfe(sess, cliente_id, documento, prazo=prazo)
-            capturar_cte(sess, cliente_id, documento, prazo=prazo)
-        except Exception as exc:
-            # Isola a falha nesta empresa; as demais continuam.
-            print(f"[empresa {documento}] FALHOU: {type(exc).__name__}: {exc}; seguindo.")
-            _log_avulso(cliente_id, documento, 'erro',
-                        detalhe=f"loop multi: {type(exc).__name__}: {exc}")
-            continue
+    # XML capturados vao para o spool; este uploader os sobe para o Dropbox em
+    # paralelo com as consultas (a captura so espera a SEFAZ).
+    uploader = pd.spool.UploaderEmSegundoPlano(lambda: pymysql.connect(**cs.CONN))
+    uploader.start()
+
+    saida = _SaidaPorLane(sys.stdout)
+    sys.stdout = saida
+    try:
+        falhas = _rodar_lanes(certs, prazo)
+    finally:
+        sys.stdout = saida.original
+        # Ultimo esvaziamento dentro do que sobra do prazo (+ folga antes do
+        # timeout do subprocess). O que nao subir fica para o agendador do app.
+        up = uploader.encerrar(max(0.0, prazo - time.monotonic()) + FOLGA_UPLOAD_SEG)
+        print(f"\nXML para o Dropbox: {up['enviados']} enviado(s), {up['falhas']} "
+              f"falha(s), {up['desistidos']} desistido(s).")
 
     print("\nFIM - captura A+B multi-empresa concluida. Nada foi manifestado.")
+    if falhas:
+        # Mantem o rc=1 que o agendador via quando cs.falhar() abortava a rodada
+        # (agora so depois de as outras empresas terminarem).
+        print(f"    {len(falhas)} empresa(s) abortada(s): {', '.join(falhas)}")
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -56,8 +56,11 @@ CNPJ_PREFERIDO = "33503987000116"   # POSTO NOVO HORIZONTE GOIATUBA
 C_UF_AUTOR     = "52"               # GO
 TP_AMB         = "1"                # 1 = PRODUCAO
 
-# Webservice NACIONAL de Distribuicao de DFe (producao).
-ENDPOINT = "https://www1.nfe.fazenda.gov.br/NFeDistribuicaoDFe/NFeDistribuicaoDFe.asmx"
+# Webservice NACIONAL de Distribuicao de DFe (producao). Overridavel por env
+# SO para apontar a captura para a SEFAZ falsa local (scripts/fake_sefaz.py).
+ENDPOINT = os.environ.get(
+    "DFE_SEFAZ_ENDPOINT",
+    "https://www1.nfe.fazenda.gov.br/NFeDistribuicaoDFe/NFeDistribuicaoDFe.asmx")
 NS_WSDL  = "http://www.portalfiscal.inf.br/nfe/wsdl/NFeDistribuicaoDFe"
 NS_NFE   = "http://www.portalfiscal.inf.br/nfe"
 VERSAO   = "1.35"                   # layout do distDFeInt
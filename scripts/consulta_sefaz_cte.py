@@ -20,7 +20,10 @@ import pymysql
 import consulta_sefaz as cs   # cert/mTLS/parsers + CONN, CNPJ, C_UF_AUTOR, TP_AMB
 
 # --- Endpoint NACIONAL do CTeDistribuicaoDFe (producao) ---------------------
-ENDPOINT_CTE = "https://www1.cte.fazenda.gov.br/CTeDistribuicaoDFe/CTeDistribuicaoDFe.asmx"
+# Overridavel por env so para a SEFAZ falsa local (scripts/fake_sefaz.py).
+ENDPOINT_CTE = os.environ.get(
+    "DFE_SEFAZ_ENDPOINT_CTE",
+    "https://www1.cte.fazenda.gov.br/CTeDistribuicaoDFe/CTeDistribuicaoDFe.asmx")
 NS_WSDL_CTE  = "http://www.portalfiscal.inf.br/cte/wsdl/CTeDistribuicaoDFe"
 NS_CTE       = "http://www.portalfiscal.inf.br/cte"
 ACTION_CTE   = NS_WSDL_CTE + "/cteDistDFeInteresse"
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+# ============================================================================
+#  DROPBOX FALSO (em memoria) para testar a fila de XML de DFe OFFLINE.
+#
+#  Tem a mesma cara de integrations/dropbox_dfe (upload_xml / baixar_xml), o
+#  bastante para dfe_xml_spool.drenar(fila, enviar=fake.upload_xml) aceitar.
+#  Nada aqui fala com a rede.
+#
+#  `atraso` segura cada upload (simula a ida HTTPS), `falhas` programa quantas
+#  vezes um caminho responde erro antes de aceitar (um numero grande = fora do
+#  ar de vez) e `pico` registra quantos uploads ficaram em voo ao mesmo tempo --
+#  e o que o teste de workers confere.
+# ============================================================================
+import threading
+import time
+
+
+class FakeDropbox:
+    """Guarda os arquivos num dict {caminho: bytes}."""
+
+    def __init__(self, atraso=0.0, falhas=None):
+        self.atraso = atraso
+        self.falhas = dict(falhas or {})    # caminho -> quantas vezes ainda falha
+        self.arquivos = {}
+        self.uploads = []                   # (caminho, ok)
+        self.em_voo = 0
+        self.pico = 0
+        self._lock = threading.Lock()
+
+    def upload_xml(self, caminho, conteudo):
+        with self._lock:
+            self.em_voo += 1
+            self.pico = max(self.pico, self.em_voo)
+        try:
+            if self.atraso:
+                time.sleep(self.atraso)
+            with self._lock:
+                if self.falhas.get(caminho, 0) > 0:
+                    self.falhas[caminho] -= 1
+                    self.uploads.append((caminho, False))
+                    raise RuntimeError(
+                        f'Erro inesperado ao enviar arquivo para o Dropbox em "{caminho}": 503')
+                self.arquivos[caminho] = bytes(conteudo)
+                self.uploads.append((caminho, True))
+        finally:
+            with self._lock:
+                self.em_voo -= 1
+        return {"path": caminho.lower(), "tamanho": len(conteudo)}
+
+    def baixar_xml(self, caminho):
+        return self.arquivos.get(caminho)
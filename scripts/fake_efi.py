@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+# ============================================================================
+#  EFI FALSA (local, HTTP puro) para testar a reconciliacao de boletos OFFLINE.
+#
+#  Responde o bastante da API de cobrancas da EFI Pay para
+#  integrations/efi_reconcilia.reconciliar aceitar:
+#    POST /v1/authorize         -> access_token
+#    GET  /v1/charges           -> listagem paginada (status, begin_date,
+#                                  end_date pela data de CRIACAO, limit, page)
+#    GET  /v1/charge/<id>       -> detalhe, com payment.paid_at quando pago
+#  Nada aqui fala com a rede externa.
+#
+#  `cobrancas` e uma lista de dicts {id, status, created_at, paid_at}; a
+#  listagem NAO traz paid_at (como a de verdade), so o detalhe. `atraso` segura
+#  cada resposta (latencia da EFI), `pico` registra quantas requisicoes ficaram
+#  em voo ao mesmo tempo e `conexoes` quantas conexoes TCP foram abertas -- e o
+#  que o teste de concorrencia/pool confere.
+#
+#  Uso (standalone):
+#      python scripts/fake_efi.py [porta] [n_cobrancas]
+#      EFI_API_BASE=http://127.0.0.1:<porta> ... (ver scripts/testar_efi_reconcilia.py)
+# ============================================================================
+import json
+import random
+import sys
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def gerar_cobrancas(n, dias=90, seed=11, hoje=None):
+    """n cobrancas espalhadas nos ultimos `dias`: ~60% pagas, ~10% liquidadas,
+    ~10% canceladas, o resto aguardando."""
+    rnd = random.Random(seed)
+    hoje = hoje or date.today()
+    cobrancas = []
+    for i in range(1, n + 1):
+        criada = hoje - timedelta(days=rnd.randrange(dias))
+        sorte = rnd.random()
+        status = ('paid' if sorte < 0.6 else 'settled' if sorte < 0.7
+                  else 'canceled' if sorte < 0.8 else 'waiting')
+        pago = (criada + timedelta(days=rnd.randrange(1, 10))).isoformat() \
+            if status in ('paid', 'settled') else None
+        cobrancas.append({'id': 500000 + i, 'status': status,
+                          'created_at': criada.isoformat(), 'paid_at': pago})
+    return cobrancas
+
+
+class FakeEfi:
+    """Servidor HTTP local. `url` vale como EFI_API_BASE."""
+
+    def __init__(self, cobrancas=(), porta=0, atraso=0.0):
+        self.cobrancas = list(cobrancas)
+        self.atraso = atraso
+        self.requisicoes = []   # (metodo, caminho, query)
+        self.conexoes = 0
+        self.em_voo = 0
+        self.pico = 0
+        self._lock = threading.Lock()
+        self._srv = ThreadingHTTPServer(("127.0.0.1", porta), self._handler())
+        self._srv.daemon_threads = True
+        self._thread = None
+
+    @property
+    def porta(self):
+        return self._srv.server_address[1]
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.porta}"
+
+    def listar(self, q):
+        status = q.get('status')
+        ini, fim = q.get('begin_date', '0000-00-00'), q.get('end_date', '9999-99-99')
+        limite, pagina = int(q.get('limit', 100)), int(q.get('page', 1))
+        achadas = [c for c in self.cobrancas
+                   if (not status or c['status'] == status) and ini <= c['created_at'] <= fim]
+        total_paginas = max(1, -(-len(achadas) // limite))
+        fatia = achadas[(pagina - 1) * limite:pagina * limite]
+        return {'code': 200,
+                'data': [{'id': c['id'], 'status': c['status'], 'created_at': c['created_at']}
+                         for c in fatia],
+                'paginate': {'limit': limite, 'page': pagina, 'totalPages': total_paginas}}
+
+    def detalhar(self, charge_id):
+        for c in self.cobrancas:
+            if str(c['id']) == str(charge_id):
+                corpo = {'charge_id': c['id'], 'status': c['status'], 'created_at': c['created_at']}
+                if c.get('paid_at'):
+                    corpo['payment'] = {'paid_at': c['paid_at']}
+                return 200, {'code': 200, 'data': corpo}
+        return 404, {'code': 404, 'error': 'charge_not_found'}
+
+    def _handler(self):
+        fake = self
+
+        class _H(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"   # keep-alive: o pool da Session reaproveita
+            disable_nagle_algorithm = True  # cabecalho e corpo saem em dois write()
+
+            def setup(self):
+                super().setup()
+                with fake._lock:
+                    fake.conexoes += 1
+
+            def _responder(self, codigo, corpo):
+                dados = json.dumps(corpo).encode("utf-8")
+                self.send_response(codigo)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(dados)))
+                self.end_headers()
+                self.wfile.write(dados)
+
+            def _atender(self, metodo):
+                url = urlparse(self.path)
+                q = {k: v[0] for k, v in parse_qs(url.query).items()}
+                if metodo == 'POST':
+                    self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                with fake._lock:
+                    fake.requisicoes.append((metodo, url.path, q))
+                    fake.em_voo += 1
+                    fake.pico = max(fake.pico, fake.em_voo)
+                try:
+                    if fake.atraso:
+                        time.sleep(fake.atraso)
+                    if metodo == 'POST' and url.path == '/v1/authorize':
+                        return self._responder(200, {'access_token': 'token-falso',
+                                                     'expires_in': 3600})
+                    if url.path == '/v1/charges':
+                        return self._responder(200, fake.listar(q))
+                    if url.path.startswith('/v1/charge/'):
+                        return self._responder(*fake.detalhar(url.path.rsplit('/', 1)[-1]))
+                    return self._responder(404, {'code': 404})
+                finally:
+                    with fake._lock:
+                        fake.em_voo -= 1
+
+            def do_GET(self):
+                self._atender('GET')
+
+            def do_POST(self):
+                self._atender('POST')
+
+            def log_message(self, *a):
+                pass
+
+        return _H
+
+    def iniciar(self):
+        self._thread = threading.Thread(target=self._srv.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def parar(self):
+        self._srv.shutdown()
+        self._srv.server_close()
+
+
+if __name__ == "__main__":
+    porta = int(sys.argv[1]) if len(sys.argv) > 1 else 8766
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    fake = FakeEfi(gerar_cobrancas(n), porta=porta, atraso=0.2)
+    print(f"EFI falsa em {fake.url} com {n} cobrancas. Ctrl+C para sair.")
+    try:
+        fake._srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+# ============================================================================
+#  IMAP FALSO (local, TCP puro, sem TLS) para testar a importacao ELS OFFLINE.
+#
+#  Fala o bastante de IMAP4rev1 para o imaplib e para
+#  integrations/els_email (_buscar_lotes, marcar_lidos) aceitarem:
+#    CAPABILITY, LOGIN, SELECT (com UIDVALIDITY e UIDNEXT), UID SEARCH (FROM,
+#    SENTSINCE, UNSEEN, UID <conjunto>), UID FETCH <conjunto> (BODY.PEEK[]),
+#    UID STORE <conjunto> +FLAGS (\Seen), CLOSE, LOGOUT.
+#  Nada aqui fala com a rede externa.
+#
+#  `mensagens` e uma lista de dicts {uid, de, data, corpo(bytes), lida}.
+#  `comandos` guarda cada comando recebido (verbo, argumentos) -- e o que o
+#  teste confere: quantos UID FETCH, com que conjunto, e o criterio da busca.
+#  `atraso` segura cada resposta (latencia do provedor).
+#
+#  Uso (standalone):
+#      python scripts/fake_imap.py [porta] [n_mensagens]
+#      ELS_MAIL_IMAP_HOST=127.0.0.1 ELS_MAIL_IMAP_PORT=<porta> \
+#      ELS_MAIL_IMAP_SSL=0 ELS_MAIL_USER=x ELS_MAIL_PASSWORD=x ...
+# ============================================================================
+import random
+import shlex
+import socketserver
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from email.mime.text import MIMEText
+from email.utils import format_datetime
+
+REMETENTE = "notificacao@sistemaels.com.br"
+
+_PRODUTOS = ["GASOLINA COMUM", "ETANOL HIDRATADO", "DIESEL S10 COMUM", "DIESEL S500 COMUM"]
+
+
+def _l(v):
+    return f"{v:,.0f} L".replace(",", ".")
+
+
+def html_abertura(quando, rnd):
+    linhas = ["<p>Fechamento de turno - ABERTURA</p>",
+              f"<p>Data/Hora: {quando:%d/%m/%Y %H:%M:%S}</p>",
+              "<p>T&iacute;tulo: ABERTURA</p>"]
+    for t, prod in enumerate(_PRODUTOS, 1):
+        vol = rnd.randrange(2000, 14000)
+        linhas.append(
+            "<table>"
+            f"<tr><td>Tanque:</td><td>{t} - {prod}</td></tr>"
+            "<tr><td>Capacidade:</td><td>15.000 L</td></tr>"
+            f"<tr><td>Volume livre:</td><td>{_l(15000 - vol)}</td></tr>"
+            f"<tr><td>Volume atual:</td><td>{_l(vol)}</td></tr>"
+            f"<tr><td>Volume atual (20&deg;C):</td><td>{_l(vol * 0.996)}</td></tr>"
+            f"<tr><td>Altura:</td><td>{rnd.randrange(300, 2500)} mm</td></tr>"
+            "<tr><td>&Aacute;gua:</td><td>0 mm</td></tr>"
+            "<tr><td>Temperatura:</td><td>25,4 &deg;C</td></tr>"
+            "</table>")
+    return "<html><body>" + "".join(linhas) + "</body></html>"
+
+
+def html_descarga(quando, tanque, rnd):
+    total = rnd.randrange(3000, 10000)
+    ini = rnd.randrange(1000, 4000)
+    return (
+        "<html><body><p>Alarme descarga</p><table>"
+        f"<tr><td>Tanque:</td><td>{tanque} - {_PRODUTOS[(tanque - 1) % 4]}</td></tr>"
+        "<tr><td>Capacidade:</td><td>15.000 L</td></tr>"
+        f"<tr><td>Data Inicial:</td><td>{quando - timedelta(minutes=40):%d/%m/%Y %H:%M:%S}</td></tr>"
+        f"<tr><td>Data Final:</td><td>{quando:%d/%m/%Y %H:%M:%S}</td></tr>"
+        f"<tr><td>Volume inicial:</td><td>{_l(ini)}</td></tr>"
+        f"<tr><td>Volume final:</td><td>{_l(ini + total)}</td></tr>"
+        f"<tr><td>Volume Livre:</td><td>{_l(15000 - ini - total)}</td></tr>"
+        f"<tr><td>Total da descarga:</td><td>{_l(total)}</td></tr>"
+        f"<tr><td>Total da descarga(20C):</td><td>{_l(total * 0.996)}</td></tr>"
+        "</table></body></html>")
+
+
+def mensagem(uid, assunto, html, quando, de=REMETENTE, lida=False):
+    msg = MIMEText(html, "html", "utf-8")
+    msg["From"] = de
+    msg["Subject"] = assunto
+    msg["Date"] = format_datetime(quando)
+    return {"uid": uid, "de": de, "data": quando.date(), "corpo": msg.as_bytes(),
+            "lida": lida}
+
+
+def gerar_mensagens(n, primeiro_uid=101, hoje=None, seed=7):
+    """n e-mails do ELS no dia: ~70% ABERTURA (4 tanques), ~25% descarga,
+    o resto um aviso que o importador ignora."""
+    rnd = random.Random(seed)
+    hoje = hoje or datetime.now().replace(microsecond=0)
+    out = []
+    for i in range(n):
+        quando = hoje - timedelta(minutes=n - i)
+        sorte = rnd.random()
+        if sorte < 0.7:
+            out.append(mensagem(primeiro_uid + i, "Fechamento de turno - ABERTURA",
+                                html_abertura(quando, rnd), quando))
+        elif sorte < 0.95:
+            out.append(mensagem(primeiro_uid + i, "Alarme descarga",
+                                html_descarga(quando, 1 + i % 4, rnd), quando))
+        else:
+            out.append(mensagem(primeiro_uid + i, "Aviso de sistema",
+                                "<p>Backup concluido</p>", quando))
+    return out
+
+
+def _uids(conjunto, todos):
+    """'101:103,107,110:*' -> {101, 102, 103, 107, ...} (so os que existem)."""
+    maior = max(todos, default=0)
+    sel = set()
+    for parte in conjunto.split(","):
+        a, _, b = parte.partition(":")
+        a = maior if a == "*" else int(a)
+        b = a if not b else (maior if b == "*" else int(b))
+        lo, hi = min(a, b), max(a, b)
+        sel.update(u for u in todos if lo <= u <= hi)
+    return sel
+
+
+class FakeImap:
+    """Servidor IMAP local. host/porta valem como ELS_MAIL_IMAP_HOST/PORT."""
+
+    def __init__(self, mensagens=(), porta=0, atraso=0.0, uidvalidity=1700000000):
+        self.mensagens = {m["uid"]: m for m in mensagens}
+        self.atraso = atraso
+        self.uidvalidity = uidvalidity
+        self.comandos = []      # (verbo, argumentos)
+        self._lock = threading.Lock()
+        self._srv = socketserver.ThreadingTCPServer(("127.0.0.1", porta), self._handler())
+        self._srv.daemon_threads = True
+        self._thread = None
+
+    @property
+    def porta(self):
+        return self._srv.server_address[1]
+
+    def adicionar(self, *mensagens):
+        with self._lock:
+            for m in mensagens:
+                self.mensagens[m["uid"]] = m
+
+    def fetches(self):
+        return [a for v, a in self.comandos if v == "UID FETCH"]
+
+    def buscar(self, criterio):
+        toks = shlex.split(criterio.strip().strip("()"))
+        with self._lock:
+            sel = set(self.mensagens)
+            i = 0
+            while i < len(toks):
+                t = toks[i].upper()
+                if t == "FROM":
+                    alvo = toks[i + 1].lower()
+                    sel = {u for u in sel if alvo in self.mensagens[u]["de"].lower()}
+                    i += 2
+                elif t == "SENTSINCE":
+                    d = datetime.strptime(toks[i + 1], "%d-%b-%Y").date()
+                    sel = {u for u in sel if self.mensagens[u]["data"] >= d}
+                    i += 2
+                elif t == "UNSEEN":
+                    sel = {u for u in sel if not self.mensagens[u]["lida"]}
+                    i += 1
+                elif t == "UID":
+                    sel &= _uids(toks[i + 1], self.mensagens)
+                    i += 2
+                else:
+                    raise ValueError("criterio nao suportado: " + t)
+        return sorted(sel)
+
+    def _handler(self):
+        fake = self
+
+        class _H(socketserver.StreamRequestHandler):
+            disable_nagle_algorithm = True
+
+            def _linha(self, texto):
+                self.wfile.write(texto.encode("utf-8") + b"\r\n")
+
+            def handle(self):
+                self._linha("* OK IMAP4rev1 falso pronto")
+                while True:
+                    linha = self.rfile.readline()
+                    if not linha:
+                        return
+                    tag, _, resto = linha.decode("utf-8").rstrip("\r\n").partition(" ")
+                    verbo, _, args = resto.partition(" ")
+                    verbo = verbo.upper()
+                    if verbo == "UID":
+                        sub, _, args = args.partition(" ")
+                        verbo = "UID " + sub.upper()
+                    with fake._lock:
+                        fake.comandos.append((verbo, args))
+                    if fake.atraso:
+                        time.sleep(fake.atraso)
+                    if not self._atender(tag, verbo, args):
+                        return
+
+            def _atender(self, tag, verbo, args):
+                if verbo == "CAPABILITY":
+                    self._linha("* CAPABILITY IMAP4rev1")
+                elif verbo == "SELECT":
+                    self._linha(f"* {len(fake.mensagens)} EXISTS")
+                    self._linha(f"* OK [UIDVALIDITY {fake.uidvalidity}] UIDs validos")
+                    self._linha(f"* OK [UIDNEXT {max(fake.mensagens, default=0) + 1}] proximo")
+                    self._linha(f"{tag} OK [READ-WRITE] SELECT completed")
+                    return True
+                elif verbo == "UID SEARCH":
+                    self._linha("* SEARCH " + " ".join(map(str, fake.buscar(args))))
+                elif verbo == "UID FETCH":
+                    conjunto = args.split(" ", 1)[0]
+                    with fake._lock:
+                        alvo = sorted(_uids(conjunto, fake.mensagens))
+                        corpos = [(u, fake.mensagens[u]["corpo"]) for u in alvo]
+                    partes = []
+                    for seq, (u, corpo) in enumerate(corpos, 1):
+                        partes.append(b"* %d FETCH (UID %d BODY[] {%d}\r\n" % (seq, u, len(corpo))
+                                      + corpo + b")\r\n")
+                    self.wfile.write(b"".join(partes))
+                elif verbo == "UID STORE":
+                    conjunto = args.split(" ", 1)[0]
+                    with fake._lock:
+                        for u in _uids(conjunto, fake.mensagens):
+                            fake.mensagens[u]["lida"] = True
+                elif verbo == "LOGOUT":
+                    self._linha("* BYE ate logo")
+                    self._linha(f"{tag} OK LOGOUT completed")
+                    return False
+                elif verbo not in ("LOGIN", "CLOSE", "NOOP"):
+                    self._linha(f"{tag} BAD comando nao suportado")
+                    return True
+                self._linha(f"{tag} OK {verbo} completed")
+                return True
+
+        return _H
+
+    def iniciar(self):
+        self._thread = threading.Thread(target=self._srv.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def parar(self):
+        self._srv.shutdown()
+        self._srv.server_close()
+
+
+if __name__ == "__main__":
+    porta = int(sys.argv[1]) if len(sys.argv) > 1 else 1143
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    fake = FakeImap(gerar_mensagens(n), porta=porta, atraso=0.05)
+    print(f"IMAP falso em 127.0.0.1:{fake.porta} com {n} e-mails do ELS "
+          f"(ELS_MAIL_IMAP_SSL=0). Ctrl+C para sair.")
+    try:
+        fake._srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+# ============================================================================
+#  SEFAZ FALSA (local, HTTP puro) para testar a captura de DFe OFFLINE.
+#
+#  Responde ao SOAP de distDFeInt da NF-e e do CT-e com a MESMA estrutura da
+#  SEFAZ de verdade (retDistDFeInt + loteDistDFeInt/docZip em gzip+base64), o
+#  bastante para captura_massa_dfe._consultar/_consultar_cte e
+#  processa_dfe.processar_um_doc aceitarem. Nada aqui fala com a rede externa.
+#
+#  Por CNPJ interessado mantem uma janela de NSU (1..max_nsu): cada consulta
+#  devolve ate `docs_por_lote` resNFe/resCTe a partir do ultNSU pedido (138) e,
+#  quando acaba, 137. CNPJs em `cnpjs_656` recebem 656 (consumo indevido).
+#  `atraso` segura cada resposta (simula a latencia da SEFAZ) e `pico` registra
+#  quantas requisicoes ficaram em voo ao mesmo tempo -- e o que o teste de
+#  concorrencia confere.
+#
+#  Uso (standalone):
+#      python scripts/fake_sefaz.py [porta]
+#      DFE_SEFAZ_ENDPOINT=http://127.0.0.1:<porta>/nfe \
+#      DFE_SEFAZ_ENDPOINT_CTE=http://127.0.0.1:<porta>/cte \
+#          python scripts/captura_massa_dfe.py
+# ============================================================================
+import base64
+import gzip
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_RE_CNPJ = re.compile(rb"<CNPJ>(\d+)</CNPJ>")
+_RE_ULT = re.compile(rb"<ultNSU>(\d+)</ultNSU>")
+
+
+def _doczip(xml, nsu, schema):
+    b64 = base64.b64encode(gzip.compress(xml.encode("utf-8"))).decode("ascii")
+    return f'<docZip NSU="{nsu:015d}" schema="{schema}">{b64}</docZip>'
+
+
+def _res_nfe(cnpj, nsu):
+    chave = f"52{2607}{cnpj[:14].zfill(14)}55001{nsu:09d}1{nsu:08d}0"[:44].ljust(44, "0")
+    return _doczip(
+        '<resNFe xmlns="http://www.portalfiscal.inf.br/nfe" versao="1.01">'
+        f'<chNFe>{chave}</chNFe><CNPJ>{cnpj}</CNPJ><xNome>FORNECEDOR FALSO</xNome>'
+        '<dhEmi>2026-07-01T10:00:00-03:00</dhEmi><vNF>100.00</vNF>'
+        '<cSitNFe>1</cSitNFe></resNFe>', nsu, "resNFe_v1.01.xsd")
+
+
+def _res_cte(cnpj, nsu):
+    chave = f"52{2607}{cnpj[:14].zfill(14)}57001{nsu:09d}1{nsu:08d}0"[:44].ljust(44, "0")
+    return _doczip(
+        '<resCTe xmlns="http://www.portalfiscal.inf.br/cte" versao="1.00">'
+        f'<chCTe>{chave}</chCTe><CNPJ>{cnpj}</CNPJ><xNome>TRANSPORTADORA FALSA</xNome>'
+        '<dhEmi>2026-07-01T10:00:00-03:00</dhEmi><vTPrest>50.00</vTPrest>'
+        '<cSitCTe>1</cSitCTe></resCTe>', nsu, "resCTe_v1.00.xsd")
+
+
+def _envelope(cstat, xmotivo, ult, maxnsu, docs=""):
+    lote = f"<loteDistDFeInt>{docs}</loteDistDFeInt>" if docs else ""
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>'
+        '<soap:Envelope xmlns:soap="http://www.w3.org/2003/05/soap-envelope">'
+        '<soap:Body><nfeDistDFeInteresseResponse><nfeDistDFeInteresseResult>'
+        '<retDistDFeInt xmlns="http://www.portalfiscal.inf.br/nfe" versao="1.35">'
+        f'<tpAmb>1</tpAmb><verAplic>FAKE</verAplic><cStat>{cstat}</cStat>'
+        f'<xMotivo>{xmotivo}</xMotivo><dhResp>2026-07-01T10:00:00-03:00</dhResp>'
+        f'<ultNSU>{ult:015d}</ultNSU><maxNSU>{maxnsu:015d}</maxNSU>{lote}'
+        '</retDistDFeInt>'
+        '</nfeDistDFeInteresseResult></nfeDistDFeInteresseResponse>'
+        '</soap:Body></soap:Envelope>'
+    ).encode("utf-8")
+
+
+class FakeSefaz:
+    """Servidor HTTP local. `url_nfe`/`url_cte` valem como DFE_SEFAZ_ENDPOINT(_CTE)."""
+
+    def __init__(self, porta=0, max_nsu=10, docs_por_lote=5, atraso=0.0,
+                 cnpjs_656=()):
+        self.max_nsu = max_nsu
+        self.docs_por_lote = docs_por_lote
+        self.atraso = atraso
+        self.cnpjs_656 = set(cnpjs_656)
+        self.requisicoes = []   # (servico, cnpj, ult_nsu, cstat)
+        self.em_voo = 0
+        self.pico = 0
+        self._lock = threading.Lock()
+        self._srv = ThreadingHTTPServer(("127.0.0.1", porta), self._handler())
+        self._srv.daemon_threads = True
+        self._thread = None
+
+    @property
+    def porta(self):
+        return self._srv.server_address[1]
+
+    @property
+    def url_nfe(self):
+        return f"http://127.0.0.1:{self.porta}/nfe"
+
+    @property
+    def url_cte(self):
+        return f"http://127.0.0.1:{self.porta}/cte"
+
+    def responder(self, servico, corpo):
+        m_cnpj, m_ult = _RE_CNPJ.search(corpo), _RE_ULT.search(corpo)
+        cnpj = m_cnpj.group(1).decode() if m_cnpj else ""
+        ult = int(m_ult.group(1)) if m_ult else 0
+        if cnpj in self.cnpjs_656:
+            cstat, resp = "656", _envelope("656", "Rejeicao: Consumo Indevido", ult, self.max_nsu)
+        elif ult >= self.max_nsu:
+            cstat, resp = "137", _envelope("137", "Nenhum documento localizado", ult, self.max_nsu)
+        else:
+            fim = min(self.max_nsu, ult + self.docs_por_lote)
+            gerar = _res_cte if servico == "cte" else _res_nfe
+            docs = "".join(gerar(cnpj, n) for n in range(ult + 1, fim + 1))
+            cstat, resp = "138", _envelope("138", "Documento(s) localizado(s)", fim,
+                                           self.max_nsu, docs)
+        with self._lock:
+            self.requisicoes.append((servico, cnpj, ult, cstat))
+        return resp
+
+    def _handler(self):
+        fake = self
+
+        class _H(BaseHTTPRequestHandler):
+            def do_POST(self):
+                corpo = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                with fake._lock:
+                    fake.em_voo += 1
+                    fake.pico = max(fake.pico, fake.em_voo)
+                try:
+                    if fake.atraso:
+                        time.sleep(fake.atraso)
+                    resp = fake.responder(self.path.strip("/") or "nfe", corpo)
+                finally:
+                    with fake._lock:
+                        fake.em_voo -= 1
+                self.send_response(200)
+                self.send_header("Content-Type", "application/soap+xml; charset=utf-8")
+                self.send_header("Content-Length", str(len(resp)))
+                self.end_headers()
+                self.wfile.write(resp)
+
+            def log_message(self, *a):
+                pass
+
+        return _H
+
+    def iniciar(self):
+        self._thread = threading.Thread(target=self._srv.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def parar(self):
+        self._srv.shutdown()
+        self._srv.server_close()
+
+
+if __name__ == "__main__":
+    porta = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    fake = FakeSefaz(porta=porta, max_nsu=200, docs_por_lote=50, atraso=0.5)
+    print(f"SEFAZ falsa em {fake.url_nfe} (NF-e) e {fake.url_cte} (CT-e). Ctrl+C para sair.")
+    try:
+        fake._srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -85,7 +85,7 @@ def main():
                     caminho = local.get(n['chave'])
                     xml = open(caminho, 'rb').read() if caminho else None
                 else:
-                    xml = baixar_xml(n['xml_caminho'])
+                    xml = baixar_xml(n['xml_caminho'], con)
             except Exception as e:                            # noqa: BLE001
                 print('  ERRO   %-44s %s' % (rotulo, e))
                 erros += 1
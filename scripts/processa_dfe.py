@@ -22,11 +22,16 @@
 #    - dfe_nsu        : avanca ult_nsu/max_nsu, ult_consulta, ult_status.
 #
 #  Resumos (resNFe/resEvento) sao REDUNDANTES: so contados, nunca gravados.
-#  Transacao por documento: erro em 1 doc faz rollback so dele, loga e segue.
-#  XML de cada doc guardado sobe pro Dropbox ANTES de gravar no banco.
+#  Lote gravado em estagios (processar_lote): decode/parse do lote todo, spool,
+#  e INSERTs de varias linhas numa transacao. Se o bloco falhar, volta ao
+#  isolamento por documento (rollback so do doc que falhou) e para nele.
+#  XML de cada doc vai para o spool local + dfe_xml_outbox (mesma transacao do
+#  documento); o upload para o Dropbox e assincrono (integrations/dfe_xml_spool).
 # ============================================================================
 import os
+import re
 import sys
+import time
 import gzip
 import base64
 import xml.etree.ElementTree as ET
@@ -50,6 +55,7 @@ import pymysql
 # Reaproveita TUDO do script de consulta que ja funcionou (cStat 138).
 import consulta_sefaz as cs
 from integrations.dropbox_dfe import montar_caminho, upload_xml
+from integrations import dfe_xml_spool as spool
 from integrations.dfe_classificacao import aplicar_regras
 
 # Retencao placeholder do XML (definitiva sera decidida depois).
@@ -617,6 +623,47 @@ def resolver_produto_id(cur, cod_anp):
     return row["produto_id"] if (row and row.get("produto_id")) else None
 
 
+class DeparaAnp:
+    """De-para cod_anp -> produto_id em MEMORIA, por execucao. Mesmas fontes e
+    mesmo criterio de resolver_produto_id (produto_id mais frequente em
+    vendas_xml_itens; senao em dfe_itens), mas resolve os codigos de um lote
+    INTEIRO em 2 queries e guarda o resultado (inclusive o "sem de-para") para
+    os lotes seguintes da mesma rodada."""
+
+    def __init__(self):
+        self._mapa = {}
+
+    def carregar(self, cur, cods):
+        faltam = sorted({c for c in cods if c and c not in self._mapa})
+        for tabela in ("vendas_xml_itens", "dfe_itens"):
+            if not faltam:
+                break
+            marcas = ",".join(["%s"] * len(faltam))
+            cur.execute(
+                f"SELECT cod_anp, produto_id, COUNT(*) AS n FROM {tabela} "
+                f"WHERE cod_anp IN ({marcas}) AND produto_id IS NOT NULL "
+                "GROUP BY cod_anp, produto_id",
+                faltam,
+            )
+            melhor = {}
+            for row in cur.fetchall():
+                atual = melhor.get(row["cod_anp"])
+                if atual is None or row["n"] > atual[1]:
+                    melhor[row["cod_anp"]] = (row["produto_id"], row["n"])
+            for cod, (pid, _n) in melhor.items():
+                self._mapa[cod] = pid
+            faltam = [c for c in faltam if c not in melhor]
+        for cod in faltam:
+            self._mapa[cod] = None
+
+    def resolver(self, cur, cod_anp):
+        if not cod_anp:
+            return None
+        if cod_anp not in self._mapa:
+            self.carregar(cur, [cod_anp])
+        return self._mapa[cod_anp]
+
+
 # ==========================================================================
 # SQLs (parametrizados).
 # ==========================================================================
@@ -773,21 +820,63 @@ def bloqueado_por_cota(cliente_id):
 
 
 # ==========================================================================
-# Gravacao de UMA nota (Dropbox + banco). Transacao propria.
+# Linhas (parametros) de cada SQL. Compartilhadas pela gravacao de UM doc
+# (gravar_*) e pela gravacao EM BLOCO do lote (processar_lote): a mesma tupla
+# vale para o INSERT de uma linha ou para o INSERT de varias.
 # ==========================================================================
-def gravar_nota(conn, cur, cliente_id, cnpj_cert, nota, xml_bytes, nsu, schema,
-                agora, expira):
-    ano = nota["ano"] or agora.year
-    mes = nota["mes"] or agora.month
-    caminho = montar_caminho(cnpj_cert, ano, mes, nota["chave"])
-    upload_xml(caminho, xml_bytes)  # sobe ANTES de gravar; falha aqui aborta o doc
+def _linha_doc(cliente_id, doc, tipo, nsu, schema, caminho, expira):
+    return (
+        cliente_id, doc["chave"], tipo, nsu, schema,
+        doc["numero"], doc["serie"], doc["modelo"], doc["dh_txt"],
+        doc["emit_cnpj"], doc["emit_nome"], doc["dest_cnpj"],
+        doc["valor_total"], doc["situacao"], caminho, expira,
+    )
+
+
+def _linha_resumo(cliente_id, cnpj_cert, res, nsu, schema):
+    return (
+        cliente_id, res["chave"], res["tipo"], nsu, schema,
+        res["numero"], res["serie"], res["modelo"], res["dh_txt"],
+        res["emit_cnpj"], res["emit_nome"], cnpj_cert,   # dest = o proprio interessado
+        res["valor_total"], res["situacao"],
+    )
+
+
+def _linha_item(documento_id, it, produto_id):
+    return (
+        documento_id, it["n_item"], it["produto_xml"],
+        it["cprod_fornecedor"], it["cean"], it["cod_anp"],
+        produto_id, it["ncm"], it["unidade"], it["quantidade"],
+        it["valor_unitario"], it["valor_total"],
+    )
+
+
+def _linha_cte(documento_id, cte):
+    return (
+        documento_id, cte["cfop"], cte["nat_op"], cte["tp_cte"],
+        cte["rem_cnpj"], cte["rem_nome"], cte["dest_cnpj"], cte["dest_nome"],
+        cte["toma_codigo"], cte["toma_cnpj"], cte["toma_nome"],
+        cte["mun_ini"], cte["uf_ini"], cte["mun_fim"], cte["uf_fim"],
+        cte["vprest"], cte["vcarga"], cte["prod_predom"], cte["peso"],
+        cte["qtd_unid"], cte["rntrc"], cte["motorista_nome"],
+        cte["motorista_cpf"], cte["placa"],
+    )
+
+
+def _linha_evento(cliente_id, ev, nsu, schema, caminho, expira):
+    return (
+        cliente_id, ev["chave_evento"], ev["ch_nfe"], ev["tp_evento"],
+        ev["n_seq"], ev["descricao"], ev["dh_txt"], nsu, schema,
+        ev["org_cnpj"], caminho, expira,
+    )
 
-    cur.execute(SQL_DOC_UPSERT, (
-        cliente_id, nota["chave"], nota["tipo"], nsu, schema,
-        nota["numero"], nota["serie"], nota["modelo"], nota["dh_txt"],
-        nota["emit_cnpj"], nota["emit_nome"], nota["dest_cnpj"],
-        nota["valor_total"], nota["situacao"], caminho, expira,
-    ))
+
+# ==========================================================================
+# Gravacao de UMA nota (Dropbox + banco). Transacao propria.
+# ==========================================================================
+def _sql_nota(cur, cliente_id, nota, tipo, nsu, schema, caminho, expira, depara=None):
+    cur.execute(SQL_DOC_UPSERT, _linha_doc(cliente_id, nota, tipo, nsu, schema,
+                                           caminho, expira))
     cur.execute(SQL_DOC_ID, (nota["chave"],))
     row = cur.fetchone()
     documento_id = row["id"] if row else None
@@ -796,13 +885,11 @@ def gravar_nota(conn, cur, cliente_id, cnpj_cert, nota, xml_bytes, nsu, schema,
 
     n_itens = 0
     for it in nota["itens"]:
-        produto_id = resolver_produto_id(cur, it["cod_anp"])
-        cur.execute(SQL_ITEM_UPSERT, (
-            documento_id, it["n_item"], it["produto_xml"],
-            it["cprod_fornecedor"], it["cean"], it["cod_anp"],
-            produto_id, it["ncm"], it["unidade"], it["quantidade"],
-            it["valor_unitario"], it["valor_total"],
-        ))
+        if depara is not None:
+            produto_id = depara.resolver(cur, it["cod_anp"])
+        else:
+            produto_id = resolver_produto_id(cur, it["cod_anp"])
+        cur.execute(SQL_ITEM_UPSERT, _linha_item(documento_id, it, produto_id))
         n_itens += 1
 
     # Cobranca (vencimento por parcela). Nota a vista costuma nao ter <cobr>:
@@ -811,7 +898,18 @@ def gravar_nota(conn, cur, cliente_id, cnpj_cert, nota, xml_bytes, nsu, schema,
         cur.execute(SQL_DUP_UPSERT, (
             documento_id, dup["n_dup"], dup["vencimento"], dup["valor"],
         ))
+    return n_itens
 
+
+def gravar_nota(conn, cur, cliente_id, cnpj_cert, nota, xml_bytes, nsu, schema,
+                agora, expira, depara=None):
+    ano = nota["ano"] or agora.year
+    mes = nota["mes"] or agora.month
+    caminho = montar_caminho(cnpj_cert, ano, mes, nota["chave"])
+    upload_xml(caminho, xml_bytes)  # sobe ANTES de gravar; falha aqui aborta o doc
+
+    n_itens = _sql_nota(cur, cliente_id, nota, nota["tipo"], nsu, schema,
+                        caminho, expira, depara)
     conn.commit()
     return n_itens
 
@@ -819,6 +917,16 @@ def gravar_nota(conn, cur, cliente_id, cnpj_cert, nota, xml_bytes, nsu, schema,
 # ==========================================================================
 # Gravacao de UM evento (Dropbox + banco). Transacao propria.
 # ==========================================================================
+def _sql_evento(cur, cliente_id, ev, nsu, schema, caminho, expira, sql_cancela):
+    cur.execute(SQL_EVENTO_UPSERT, _linha_evento(cliente_id, ev, nsu, schema,
+                                                 caminho, expira))
+    cancelou = False
+    if ev["tp_evento"] == TP_CANCELAMENTO and ev["ch_nfe"]:
+        cur.execute(sql_cancela, (ev["ch_nfe"],))
+        cancelou = cur.rowcount and cur.rowcount > 0
+    return bool(cancelou)
+
+
 def gravar_evento(conn, cur, cliente_id, cnpj_cert, ev, xml_bytes, nsu, schema,
                   agora, expira):
     ano = ev["ano"] or agora.year
@@ -827,19 +935,10 @@ def gravar_evento(conn, cur, cliente_id, cnpj_cert, ev, xml_bytes, nsu, schema,
     caminho = montar_caminho(cnpj_cert, ano, mes, ev["chave_evento"])
     upload_xml(caminho, xml_bytes)
 
-    cur.execute(SQL_EVENTO_UPSERT, (
-        cliente_id, ev["chave_evento"], ev["ch_nfe"], ev["tp_evento"],
-        ev["n_seq"], ev["descricao"], ev["dh_txt"], nsu, schema,
-        ev["org_cnpj"], caminho, expira,
-    ))
-
-    cancelou = False
-    if ev["tp_evento"] == TP_CANCELAMENTO and ev["ch_nfe"]:
-        cur.execute(SQL_CANCELA_NOTA, (ev["ch_nfe"],))
-        cancelou = cur.rowcount and cur.rowcount > 0
-
+    cancelou = _sql_evento(cur, cliente_id, ev, nsu, schema, caminho, expira,
+                           SQL_CANCELA_NOTA)
     conn.commit()
-    return bool(cancelou)
+    return cancelou
 
 
 # ==========================================================================
@@ -854,19 +953,10 @@ def gravar_evento_cte(conn, cur, cliente_id, cnpj_cert, ev, xml_bytes, nsu, sche
     caminho = montar_caminho(cnpj_cert, ano, mes, ev["chave_evento"])
     upload_xml(caminho, xml_bytes)
 
-    cur.execute(SQL_EVENTO_UPSERT, (
-        cliente_id, ev["chave_evento"], ev["ch_nfe"], ev["tp_evento"],
-        ev["n_seq"], ev["descricao"], ev["dh_txt"], nsu, schema,
-        ev["org_cnpj"], caminho, expira,
-    ))
-
-    cancelou = False
-    if ev["tp_evento"] == TP_CANCELAMENTO and ev["ch_nfe"]:
-        cur.execute(SQL_CANCELA_CTE, (ev["ch_nfe"],))   # <- so muda o UPDATE: tipo='CTe'
-        cancelou = cur.rowcount and cur.rowcount > 0
-
+    cancelou = _sql_evento(cur, cliente_id, ev, nsu, schema, caminho, expira,
+                           SQL_CANCELA_CTE)   # <- so muda o UPDATE: tipo='CTe'
     conn.commit()
-    return bool(cancelou)
+    return cancelou
 
 
 # ==========================================================================
@@ -874,12 +964,7 @@ def gravar_evento_cte(conn, cur, cliente_id, cnpj_cert, ev, xml_bytes, nsu, sche
 # o XML da nota). resumo=1. Idempotente e nao rebaixa nota completa (SQL_RESUMO_UPSERT).
 # ==========================================================================
 def gravar_resumo_nota(conn, cur, cliente_id, cnpj_cert, res, nsu, schema):
-    cur.execute(SQL_RESUMO_UPSERT, (
-        cliente_id, res["chave"], res["tipo"], nsu, schema,
-        res["numero"], res["serie"], res["modelo"], res["dh_txt"],
-        res["emit_cnpj"], res["emit_nome"], cnpj_cert,   # dest = o proprio interessado
-        res["valor_total"], res["situacao"],
-    ))
+    cur.execute(SQL_RESUMO_UPSERT, _linha_resumo(cliente_id, cnpj_cert, res, nsu, schema))
     conn.commit()
 
 
@@ -888,40 +973,32 @@ def gravar_resumo_nota(conn, cur, cliente_id, cnpj_cert, res, nsu, schema):
 # dfe_cte_nfe). Espelha gravar_nota. Transacao propria. Retorna qtd de NF-e
 # vinculadas gravadas.
 # ==========================================================================
-def gravar_cte(conn, cur, cliente_id, cnpj_cert, cte, xml_bytes, nsu, schema,
-               agora, expira):
-    ano = cte["ano"] or agora.year
-    mes = cte["mes"] or agora.month
-    caminho = montar_caminho(cnpj_cert, ano, mes, cte["chave"])
-    upload_xml(caminho, xml_bytes)  # sobe ANTES; falha aqui aborta o doc
-
-    cur.execute(SQL_DOC_UPSERT, (
-        cliente_id, cte["chave"], "CTe", nsu, schema,
-        cte["numero"], cte["serie"], cte["modelo"], cte["dh_txt"],
-        cte["emit_cnpj"], cte["emit_nome"], cte["dest_cnpj"],
-        cte["valor_total"], cte["situacao"], caminho, expira,
-    ))
+def _sql_cte(cur, cliente_id, cte, nsu, schema, caminho, expira):
+    cur.execute(SQL_DOC_UPSERT, _linha_doc(cliente_id, cte, "CTe", nsu, schema,
+                                           caminho, expira))
     cur.execute(SQL_DOC_ID, (cte["chave"],))
     row = cur.fetchone()
     documento_id = row["id"] if row else None
     if not documento_id:
         raise RuntimeError("nao recuperou documento_id do CTe apos upsert")
 
-    cur.execute(SQL_CTE_UPSERT, (
-        documento_id, cte["cfop"], cte["nat_op"], cte["tp_cte"],
-        cte["rem_cnpj"], cte["rem_nome"], cte["dest_cnpj"], cte["dest_nome"],
-        cte["toma_codigo"], cte["toma_cnpj"], cte["toma_nome"],
-        cte["mun_ini"], cte["uf_ini"], cte["mun_fim"], cte["uf_fim"],
-        cte["vprest"], cte["vcarga"], cte["prod_predom"], cte["peso"],
-        cte["qtd_unid"], cte["rntrc"], cte["motorista_nome"],
-        cte["motorista_cpf"], cte["placa"],
-    ))
+    cur.execute(SQL_CTE_UPSERT, _linha_cte(documento_id, cte))
 
     n_nfe = 0
     for ch in cte["chaves_nfe"]:
         cur.execute(SQL_CTE_NFE_UPSERT, (documento_id, ch))
         n_nfe += 1
+    return n_nfe
+
+
+def gravar_cte(conn, cur, cliente_id, cnpj_cert, cte, xml_bytes, nsu, schema,
+               agora, expira):
+    ano = cte["ano"] or agora.year
+    mes = cte["mes"] or agora.month
+    caminho = montar_caminho(cnpj_cert, ano, mes, cte["chave"])
+    upload_xml(caminho, xml_bytes)  # sobe ANTES; falha aqui aborta o doc
 
+    n_nfe = _sql_cte(cur, cliente_id, cte, nsu, schema, caminho, expira)
     conn.commit()
     return n_nfe
 
@@ -931,12 +1008,7 @@ def gravar_cte(conn, cur, cliente_id, cnpj_cert, cte, xml_bytes, nsu, schema,
 # nao rebaixa CT-e completo (reaproveita SQL_RESUMO_UPSERT).
 # ==========================================================================
 def gravar_resumo_cte(conn, cur, cliente_id, cnpj_cert, res, nsu, schema):
-    cur.execute(SQL_RESUMO_UPSERT, (
-        cliente_id, res["chave"], res["tipo"], nsu, schema,
-        res["numero"], res["serie"], res["modelo"], res["dh_txt"],
-        res["emit_cnpj"], res["emit_nome"], cnpj_cert,
-        res["valor_total"], res["situacao"],
-    ))
+    cur.execute(SQL_RESUMO_UPSERT, _linha_resumo(cliente_id, cnpj_cert, res, nsu, schema))
     conn.commit()
 
 
@@ -957,7 +1029,7 @@ def gravar_resumo_cte(conn, cur, cliente_id, cnpj_cert, res, nsu, schema):
 # Retorna (kind, n_itens, cancelou) com kind in
 # {"nota","evento","resumo","outro"}.
 # ==========================================================================
-def processar_um_doc(conn, cur, cliente_id, cnpj_cert, d, agora, expira):
+def processar_um_doc(conn, cur, cliente_id, cnpj_cert, d, agora, expira, depara=None):
     schema = d.get("schema") or None
     nsu = _to_int(d.get("NSU"))
     b64 = d.text or ""
@@ -970,7 +1042,7 @@ def processar_um_doc(conn, cur, cliente_id, cnpj_cert, d, agora, expira):
     if raiz == "nfeProc":
         nota = extrair_nota(root)
         ni = gravar_nota(conn, cur, cliente_id, cnpj_cert, nota,
-                         xml_bytes, nsu, schema, agora, expira)
+                         xml_bytes, nsu, schema, agora, expira, depara)
         return "nota", ni, False
 
     if raiz == "procEventoNFe":
@@ -1009,6 +1081,289 @@ def processar_um_doc(conn, cur, cliente_id, cnpj_cert, d, agora, expira):
     return "outro", 0, False
 
 
+# ==========================================================================
+# LOTE INTEIRO em estagios (decode -> parse -> spool -> SQL).
+#
+# processar_um_doc faz tudo por documento: 1 commit e ~10 idas ao banco por
+# nota (upsert, SELECT id, 1 upsert + 2 consultas de de-para POR ITEM...). Num
+# lote de 50 docs isso e o grosso do tempo da captura. Aqui:
+#
+#   decode/parse : o lote todo e descompactado e parseado ANTES de tocar o banco;
+#   de-para      : cod_anp -> produto_id resolvido de uma vez (DeparaAnp, por
+#                  execucao -- os lotes seguintes nem consultam);
+#   spool        : XMLs no spool local (disco), em ordem de NSU. O upload para
+#                  o Dropbox sai do caminho critico: quem sobe e o drenador da
+#                  dfe_xml_outbox (integrations/dfe_xml_spool);
+#   SQL          : dfe_documentos / dfe_itens / dfe_duplicatas / dfe_cte /
+#                  dfe_cte_nfe / dfe_eventos / dfe_xml_outbox em INSERTs de
+#                  varias linhas, numa transacao so.
+#
+# Se o bloco falhar (ou o lote tiver docs que dependem da ORDEM entre si: a
+# mesma chave duas vezes, evento de uma nota do proprio lote), desfaz e volta
+# ao isolamento por documento -- mesmos _sql_* de gravar_*, commit por doc --
+# parando no primeiro que falhar. A regra do ponteiro nao muda: o que volta
+# em `resultados` foi gravado, em ordem de NSU, e o ult_nsu so pode avancar
+# ate o ultimo deles.
+#
+# Retorna (resultados, erro):
+#   resultados = [(nsu, kind, n_itens, cancelou), ...] (mesmos kinds de
+#                processar_um_doc)
+#   erro       = None ou (nsu, excecao) do primeiro doc que nao foi salvo.
+# `tempos` (dict) acumula os segundos de cada estagio entre chamadas.
+# ==========================================================================
+ESTAGIOS = ("decode", "parse", "spool", "sql")
+
+# Linhas por INSERT de varias linhas (mantem o pacote bem abaixo do
+# max_allowed_packet mesmo com itens de descricao longa).
+LINHAS_POR_INSERT = 200
+
+_RE_VALUES = re.compile(r"VALUES\s*(\(.*?\))\s*(ON DUPLICATE KEY UPDATE.*)$", re.S)
+
+_PARSERS = {
+    "nfeProc": ("nota", extrair_nota),
+    "procEventoNFe": ("evento", extrair_evento),
+    "procEventoCTe": ("evento_cte", extrair_evento_cte),
+    "resNFe": ("resumo", extrair_resumo_nota),
+    "cteProc": ("cte", extrair_cte),
+    "resCTe": ("resumo_cte", extrair_resumo_cte),
+}
+
+
+def _executar_em_bloco(cur, sql, linhas, tamanho=LINHAS_POR_INSERT):
+    """Roda um dos SQL_*_UPSERT (1 linha) como INSERT de varias linhas.
+    Repete a tupla do VALUES (inclusive literais como o resumo=0/1)."""
+    if not linhas:
+        return
+    m = _RE_VALUES.search(sql)
+    if not m:
+        raise ValueError("SQL sem VALUES (...) ON DUPLICATE KEY UPDATE")
+    prefixo, tupla, sufixo = sql[:m.start(1)], m.group(1), " " + m.group(2)
+    for i in range(0, len(linhas), tamanho):
+        bloco = linhas[i:i + tamanho]
+        cur.execute(prefixo + ",".join([tupla] * len(bloco)) + sufixo,
+                    [v for linha in bloco for v in linha])
+
+
+def _cronometro(tempos, estagio, t0):
+    if tempos is not None:
+        tempos[estagio] = tempos.get(estagio, 0.0) + (time.monotonic() - t0)
+
+
+def formatar_tempos(tempos):
+    """'decode 0.01s | parse 0.05s | spool 0.02s | sql 0.30s'"""
+    return " | ".join("%s %.2fs" % (e, tempos.get(e, 0.0)) for e in ESTAGIOS)
+
+
+def _tem_dependencia_de_ordem(itens):
+    """True se o resultado do lote depende da ordem de gravacao entre docs."""
+    chaves, eventos, alvos = set(), set(), set()
+    for it in itens:
+        dados = it["dados"]
+        if it["kind"] in ("nota", "cte", "resumo", "resumo_cte"):
+            if dados["chave"] in chaves:
+                return True
+            chaves.add(dados["chave"])
+        elif it["kind"] in ("evento", "evento_cte"):
+            if dados["chave_evento"] in eventos:
+                return True
+            eventos.add(dados["chave_evento"])
+            if dados["ch_nfe"]:
+                alvos.add(dados["ch_nfe"])
+    return bool(chaves & alvos)
+
+
+def _gravar_bloco(cur, cliente_id, cnpj_cert, itens, expira, depara):
+    """Grava o lote inteiro com INSERTs de varias linhas (sem commit)."""
+    docs = [it for it in itens if it["kind"] in ("nota", "cte")]
+    resumos = [it for it in itens if it["kind"] in ("resumo", "resumo_cte")]
+    eventos = [it for it in itens if it["kind"] in ("evento", "evento_cte")]
+
+    _executar_em_bloco(cur, SQL_DOC_UPSERT, [
+        _linha_doc(cliente_id, it["dados"],
+                   "CTe" if it["kind"] == "cte" else it["dados"]["tipo"],
+                   it["nsu"], it["schema"], it["caminho"], expira)
+        for it in docs])
+    _executar_em_bloco(cur, SQL_RESUMO_UPSERT, [
+        _linha_resumo(cliente_id, cnpj_cert, it["dados"], it["nsu"], it["schema"])
+        for it in resumos])
+
+    ids = {}
+    if docs:
+        chaves = [it["dados"]["chave"] for it in docs]
+        cur.execute("SELECT id, chave FROM dfe_documentos WHERE chave IN (%s)"
+                    % ",".join(["%s"] * len(chaves)), chaves)
+        ids = {row["chave"]: row["id"] for row in cur.fetchall()}
+        faltando = [ch for ch in chaves if not ids.get(ch)]
+        if faltando:
+            raise RuntimeError("nao recuperou documento_id apos upsert: %s" % faltando[0])
+
+    notas = [it for it in docs if it["kind"] == "nota"]
+    if depara is not None:
+        depara.carregar(cur, [i["cod_anp"] for it in notas for i in it["dados"]["itens"]])
+    linhas_item, linhas_dup, linhas_cte, linhas_cte_nfe = [], [], [], []
+    for it in notas:
+        documento_id = ids[it["dados"]["chave"]]
+        for i in it["dados"]["itens"]:
+            produto_id = (depara.resolver(cur, i["cod_anp"]) if depara is not None
+                          else resolver_produto_id(cur, i["cod_anp"]))
+            linhas_item.append(_linha_item(documento_id, i, produto_id))
+        for dup in it["dados"].get("duplicatas") or []:
+            linhas_dup.append((documento_id, dup["n_dup"], dup["vencimento"], dup["valor"]))
+    for it in docs:
+        if it["kind"] == "cte":
+            documento_id = ids[it["dados"]["chave"]]
+            linhas_cte.append(_linha_cte(documento_id, it["dados"]))
+            linhas_cte_nfe.extend((documento_id, ch) for ch in it["dados"]["chaves_nfe"])
+    _executar_em_bloco(cur, SQL_ITEM_UPSERT, linhas_item)
+    _executar_em_bloco(cur, SQL_DUP_UPSERT, linhas_dup)
+    _executar_em_bloco(cur, SQL_CTE_UPSERT, linhas_cte)
+    _executar_em_bloco(cur, SQL_CTE_NFE_UPSERT, linhas_cte_nfe)
+
+    _executar_em_bloco(cur, SQL_EVENTO_UPSERT, [
+        _linha_evento(cliente_id, it["dados"], it["nsu"], it["schema"],
+                      it["caminho"], expira)
+        for it in eventos])
+    _executar_em_bloco(cur, spool.SQL_ENFILEIRAR,
+                       [_linha_outbox(it) for it in itens if it.get("sha")])
+
+    # Cancelamento: um UPDATE por evento (sao poucos) para saber o rowcount de cada.
+    cancelou = {}
+    for it in eventos:
+        ev = it["dados"]
+        if ev["tp_evento"] == TP_CANCELAMENTO and ev["ch_nfe"]:
+            sql = SQL_CANCELA_CTE if it["kind"] == "evento_cte" else SQL_CANCELA_NOTA
+            cur.execute(sql, (ev["ch_nfe"],))
+            cancelou[it["nsu"]] = bool(cur.rowcount and cur.rowcount > 0)
+
+    resultados = []
+    for it in itens:
+        resultados.append(_resultado(it, cancelou.get(it["nsu"], False)))
+    return resultados
+
+
+def _linha_outbox(it):
+    tabela, chave = it["alvo"]
+    return spool.linha_outbox(it["caminho"], it["sha"], it["tamanho"], tabela, chave,
+                              it["xml"])
+
+
+def _resultado(it, cancelou=False):
+    kind, dados = it["kind"], it["dados"]
+    if kind == "nota":
+        return it["nsu"], "nota", len(dados["itens"]), False
+    if kind == "cte":
+        return it["nsu"], "cte", len(dados["chaves_nfe"]), False
+    if kind in ("evento", "evento_cte"):
+        return it["nsu"], "evento", 0, cancelou
+    return it["nsu"], kind, 0, False
+
+
+def _gravar_um(cur, cliente_id, cnpj_cert, it, expira, depara):
+    """Isolamento por documento: mesmos SQLs de gravar_* (sem commit) + outbox."""
+    kind, dados = it["kind"], it["dados"]
+    if it.get("sha"):
+        cur.execute(spool.SQL_ENFILEIRAR, _linha_outbox(it))
+    if kind == "nota":
+        _sql_nota(cur, cliente_id, dados, dados["tipo"], it["nsu"], it["schema"],
+                  it["caminho"], expira, depara)
+        return _resultado(it)
+    if kind == "cte":
+        _sql_cte(cur, cliente_id, dados, it["nsu"], it["schema"], it["caminho"], expira)
+        return _resultado(it)
+    if kind in ("evento", "evento_cte"):
+        sql = SQL_CANCELA_CTE if kind == "evento_cte" else SQL_CANCELA_NOTA
+        canc = _sql_evento(cur, cliente_id, dados, it["nsu"], it["schema"],
+                           it["caminho"], expira, sql)
+        return _resultado(it, canc)
+    if kind in ("resumo", "resumo_cte"):
+        cur.execute(SQL_RESUMO_UPSERT,
+                    _linha_resumo(cliente_id, cnpj_cert, dados, it["nsu"], it["schema"]))
+    return _resultado(it)
+
+
+def processar_lote(conn, cur, cliente_id, cnpj_cert, docs, agora, expira,
+                   depara=None, tempos=None):
+    """Processa os docZip de UM lote (ja em ordem de NSU). Ver o bloco acima."""
+    erro = None
+
+    # 1) decode: base64 + gzip + XML. Para no primeiro corrompido.
+    t0 = time.monotonic()
+    itens = []
+    for d in docs:
+        nsu = _to_int(d.get("NSU"))
+        try:
+            xml_bytes = gzip.decompress(base64.b64decode(d.text or ""))
+            root = ET.fromstring(xml_bytes)
+        except Exception as exc:
+            erro = (nsu, exc)
+            break
+        itens.append({"nsu": nsu, "schema": d.get("schema") or None,
+                      "xml": xml_bytes, "root": root, "caminho": None})
+    _cronometro(tempos, "decode", t0)
+
+    # 2) parse: extrair_* de cada raiz modelada.
+    t0 = time.monotonic()
+    for pos, it in enumerate(itens):
+        raiz = cs._local(it["root"].tag)
+        kind, extrair = _PARSERS.get(raiz, ("outro", None))
+        try:
+            it["dados"] = extrair(it["root"]) if extrair else None
+        except Exception as exc:
+            erro = (it["nsu"], exc)
+            del itens[pos:]
+            break
+        it["kind"] = kind
+        if kind == "outro":
+            print("    [NSU %s] tipo nao modelado: raiz=%r -- seguindo." % (it["nsu"], raiz))
+    _cronometro(tempos, "parse", t0)
+
+    # 3) spool: XML completo (nota/CT-e pela chave, evento pelo Id do evento)
+    #    vai para o disco ANTES do banco; falha aqui corta o lote neste doc.
+    t0 = time.monotonic()
+    for pos, it in enumerate(itens):
+        kind, dados = it["kind"], it["dados"]
+        if kind not in ("nota", "cte", "evento", "evento_cte"):
+            continue
+        evento = kind in ("evento", "evento_cte")
+        chave = dados["chave_evento"] if evento else dados["chave"]
+        try:
+            caminho = montar_caminho(cnpj_cert, dados["ano"] or agora.year,
+                                     dados["mes"] or agora.month, chave)
+            it["sha"], it["tamanho"] = spool.guardar(caminho, it["xml"])
+        except Exception as exc:
+            erro = (it["nsu"], exc)
+            del itens[pos:]
+            break
+        it["caminho"] = caminho
+        it["alvo"] = ("dfe_eventos" if evento else "dfe_documentos", chave)
+    _cronometro(tempos, "spool", t0)
+
+    # 4) SQL: bloco numa transacao; se nao der, doc a doc.
+    t0 = time.monotonic()
+    resultados = None
+    if itens and not _tem_dependencia_de_ordem(itens):
+        try:
+            resultados = _gravar_bloco(cur, cliente_id, cnpj_cert, itens, expira, depara)
+            conn.commit()
+        except Exception as exc:
+            conn.rollback()
+            resultados = None
+            print(f"    (gravacao em bloco falhou: {exc}; isolando por documento)")
+    if resultados is None:
+        resultados = []
+        for it in itens:
+            try:
+                resultados.append(_gravar_um(cur, cliente_id, cnpj_cert, it, expira, depara))
+                conn.commit()
+            except Exception as exc:
+                conn.rollback()
+                erro = (it["nsu"], exc)
+                break
+    _cronometro(tempos, "sql", t0)
+
+    return resultados, erro
+
+
 # ==========================================================================
 # MAIN
 # ==========================================================================
@@ -1037,7 +1392,8 @@ def main():
         return
 
     # 3) Garante a tabela NOVA de eventos (idempotente, isolada).
-    print("\n[3] Garantindo tabelas dfe_eventos + dfe_cte (CREATE TABLE IF NOT EXISTS)...")
+    print("\n[3] Garantindo tabelas dfe_eventos + dfe_cte + dfe_xml_outbox "
+          "(CREATE TABLE IF NOT EXISTS)...")
     con0 = pymysql.connect(**cs.CONN)
     try:
         with con0.cursor() as c0:
@@ -1045,6 +1401,7 @@ def main():
             c0.execute(DDL_CTE)
             c0.execute(DDL_CTE_NFE)
             c0.execute(DDL_DUPLICATAS)
+            spool.garantir_tabela(c0)
         con0.commit()
     finally:
         con0.close()
@@ -1129,19 +1486,10 @@ def main():
     conn = pymysql.connect(**cs.CONN)
     try:
         cur = conn.cursor()
-        for d in docs:
-            nsu = _to_int(d.get("NSU"))
-            try:
-                kind, ni, canc = processar_um_doc(
-                    conn, cur, cliente_id, cnpj_cert, d, agora, expira)
-            except Exception as exc:
-                conn.rollback()
-                houve_falha = True
-                print(f"    [NSU {nsu}] FALHA ao salvar: {exc}")
-                print(f"    >>> PARANDO o lote. ult_nsu NAO avanca alem de {nsu_ok} "
-                      "(retenta na proxima consulta).")
-                break
-
+        tempos = {}
+        resultados, erro = processar_lote(conn, cur, cliente_id, cnpj_cert, docs,
+                                          agora, expira, DeparaAnp(), tempos)
+        for nsu, kind, ni, canc in resultados:
             if kind == "nota":
                 n_nota += 1
                 n_itens += ni
@@ -1167,6 +1515,13 @@ def main():
 
             nsu_ok = nsu   # so avanca a marca APOS salvar com sucesso
 
+        if erro:
+            houve_falha = True
+            print(f"    [NSU {erro[0]}] FALHA ao salvar: {erro[1]}")
+            print(f"    >>> PARANDO o lote. ult_nsu NAO avanca alem de {nsu_ok} "
+                  "(retenta na proxima consulta).")
+        print(f"    tempos: {formatar_tempos(tempos)}")
+
         # 6) Avanca ult_nsu SO ate o ultimo NSU salvo com sucesso (nsu_ok).
         cur.execute(SQL_NSU_OK, (
             cliente_id, cnpj_cert, nsu_ok, _to_int(ret_max) or 0, status_txt,
@@ -1188,6 +1543,18 @@ def main():
     finally:
         conn.close()
 
+    # Script de UM lote: sobe os XML do spool aqui mesmo, no fim (na captura
+    # em massa isso roda em paralelo com as consultas).
+    try:
+        up = spool.drenar_outbox(lambda: pymysql.connect(**cs.CONN))
+        if up is None:
+            print("    (XML no spool: outro processo ja esta subindo para o Dropbox)")
+        else:
+            print(f"    XML para o Dropbox: {up['enviados']} enviado(s), "
+                  f"{up['falhas']} falha(s) (retenta depois)")
+    except Exception as exc:
+        print(f"    (aviso: XML ficaram no spool, upload falhou: {exc})")
+
     # 7) Resumo.
     print("\n" + "-" * 74)
     print("RESUMO DO LOTE:")
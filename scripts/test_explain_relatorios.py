@@ -0,0 +1,167 @@
+# ============================================================
+# TESTE READ-ONLY - filtros de data sargable nos relatorios quentes
+#
+# YEAR(col)=.. AND MONTH(col)=.., DATE(col)=.. e DATE(col) BETWEEN ..
+# impedem o MySQL de usar indice: a tabela inteira e varrida a cada carga
+# do dashboard / estoque em tempo real. Os filtros agora sao intervalos
+# semiabertos (utils/periodo_sql.py) e as migrations 20261019_idx_* criam
+# os indices compostos.
+#
+# As consultas NAO sao copiadas aqui: o teste chama as funcoes de producao
+# (blocos do dashboard, lucro FIFO do dashboard, estoque tempo real e
+# auditoria) com um cursor gravador e guarda o SQL + parametros exatos.
+#
+# Parte A: sem banco. Nenhum WHERE gravado aplica YEAR/MONTH/DATE numa
+#          coluna, e nenhuma consulta casa CNPJ com REPLACE() quando as
+#          colunas geradas existem (grava como num banco ja migrado:
+#          migrations/20261019_cnpj_digitos_guardado.sql e
+#          scripts/backfill_cnpj_digitos.py --aplicar).
+# Parte B: banco real (precisa DB_PASSWORD). EXPLAIN de cada consulta; falha
+#          se vendas_posto, fretes, pedidos ou vendas_xml aparecer com
+#          type=ALL (full scan).
+# Nao altera NADA.
+#
+# Uso:
+#     python scripts/test_explain_relatorios.py
+# ============================================================
+import os
+import re
+import sys
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('SECRET_KEY', 'teste-explain')
+
+from routes import bases, estoque  # noqa: E402
+from utils import cnpj_digitos  # noqa: E402
+
+VIGIADAS = ('vendas_posto', 'fretes', 'pedidos', 'vendas_xml')
+HOJE = date(2026, 10, 15)
+
+_RE_FUNCAO_NA_COLUNA = re.compile(r'\b(YEAR|MONTH|DATE)\s*\(', re.I)
+_RE_REPLACE_CNPJ = re.compile(r'REPLACE\s*\(\s*\w+\.cnpj', re.I)
+_RE_FIM_WHERE = re.compile(r'\b(GROUP\s+BY|ORDER\s+BY|LIMIT)\b', re.I)
+_RE_TABELA = re.compile(r'\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?', re.I)
+_PALAVRAS = {'on', 'where', 'join', 'left', 'inner', 'group', 'order', 'limit'}
+
+
+class CursorGravador:
+    """Cursor que so anota (sql, params); devolve vazio/zero."""
+
+    def __init__(self, rotulo, consultas):
+        self.rotulo = rotulo
+        self.consultas = consultas
+
+    def execute(self, sql, params=()):
+        self.consultas.append((self.rotulo, sql, tuple(params)))
+
+    def fetchone(self):
+        # 1, nao 0: as marcas de id do saldo em tempo real (MAX(id) das tres
+        # tabelas) precisam ser > 0 para a semente emitir as somas.
+        return (1, 1, 1)
+
+    def fetchall(self):
+        return []
+
+    def close(self):
+        pass
+
+
+class ConexaoGravadora:
+    def __init__(self, rotulo, consultas):
+        self.rotulo = rotulo
+        self.consultas = consultas
+
+    def cursor(self, *a, **k):
+        return CursorGravador(self.rotulo, self.consultas)
+
+
+def gravar_consultas():
+    consultas = []
+    for nome in ('fretes', 'pedidos', 'grafico', 'vendas_posto', 'lucro_postos'):
+        fn = getattr(bases, '_bloco_' + nome)
+        fn(ConexaoGravadora('dashboard.' + nome, consultas), HOJE)
+    estoque.hoje_brasilia = lambda: HOJE
+    estoque.SALDO.dia = None   # forca a semente (os tres agregados)
+    estoque.dados_tempo_real(CursorGravador('estoque.dados_tempo_real', consultas), 1)
+    try:
+        estoque._auditoria_dados(CursorGravador('estoque.auditoria', consultas), 1,
+                                 date(2026, 10, 1), date(2026, 10, 15))
+    except Exception:
+        pass   # a montagem depois das consultas espera linhas; o SQL ja foi gravado
+    return consultas
+
+
+def _wheres(sql):
+    for trecho in re.split(r'\bWHERE\b', sql, flags=re.I)[1:]:
+        fim = _RE_FIM_WHERE.search(trecho)
+        yield trecho[:fim.start()] if fim else trecho
+
+
+def parte_a(consultas):
+    erros = []
+    for rotulo, sql, _p in consultas:
+        for w in _wheres(sql):
+            if _RE_FUNCAO_NA_COLUNA.search(w):
+                erros.append((rotulo, ' '.join(w.split())[:160]))
+        if _RE_REPLACE_CNPJ.search(sql):
+            erros.append((rotulo, 'CNPJ comparado com REPLACE()'))
+    for rotulo, w in erros:
+        print('FALHA  %-28s %s' % (rotulo, w))
+    assert not erros, '%d filtro(s) nao sargable' % len(erros)
+    print('OK  A: %d consultas gravadas, nenhum WHERE com YEAR/MONTH/DATE na coluna'
+          ' nem CNPJ com REPLACE()' % len(consultas))
+
+
+def _aliases(sql):
+    """alias (ou nome) -> tabela, so para as tabelas vigiadas."""
+    out = {}
+    for tabela, alias in _RE_TABELA.findall(sql):
+        if tabela.lower() in VIGIADAS:
+            if not alias or alias.lower() in _PALAVRAS:
+                alias = tabela
+            out[alias] = tabela.lower()
+    return out
+
+
+def parte_b(consultas):
+    if not os.environ.get('DB_PASSWORD'):
+        print('--  B: pulada (sem DB_PASSWORD)')
+        return
+    import pymysql
+    from utils.db_credentials import pymysql_params
+    conn = pymysql.connect(**pymysql_params(cursorclass=pymysql.cursors.DictCursor,
+                                            read_timeout=30))
+    erros = []
+    try:
+        with conn.cursor() as cur:
+            for rotulo, sql, params in consultas:
+                vigiadas = _aliases(sql)
+                if not vigiadas:
+                    continue
+                cur.execute('EXPLAIN ' + sql, params)
+                for linha in cur.fetchall():
+                    tabela = vigiadas.get(linha.get('table'))
+                    if tabela and linha.get('type') == 'ALL':
+                        erros.append((rotulo, tabela, linha.get('rows')))
+                    elif tabela:
+                        print('    %-28s %-13s type=%-6s key=%s' % (
+                            rotulo, tabela, linha.get('type'), linha.get('key')))
+    finally:
+        conn.close()
+    for rotulo, tabela, linhas in erros:
+        print('FALHA  %-28s full scan em %s (~%s linhas)' % (rotulo, tabela, linhas))
+    assert not erros, '%d full scan(s)' % len(erros)
+    print('OK  B: nenhuma consulta vigiada com type=ALL')
+
+
+def main():
+    cnpj_digitos._existentes.update(
+        (tabela, gerada) for (tabela, _o), gerada in cnpj_digitos._GERADAS.items())
+    consultas = gravar_consultas()
+    parte_a(consultas)
+    parte_b(consultas)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""Testa a captura multi-empresa em paralelo contra a SEFAZ falsa local.
+
+Nao precisa de banco, certificado nem rede externa: sobe scripts/fake_sefaz.py
+em 127.0.0.1, aponta DFE_SEFAZ_ENDPOINT(_CTE) para ele e roda as lanes de
+captura_massa_dfe._rodar_lanes com uma "empresa" que faz o MESMO laco de
+consultas (_consultar / _consultar_cte + parse dos docZip por
+processa_dfe), guardando o cursor em memoria em vez de dfe_nsu.
+
+Confere:
+  - todas as empresas chegam ao fim da janela (137), cada uma no seu cursor;
+  - o pool nunca passa de DFE_CAPTURA_PARALELO lanes e a SEFAZ nunca ve mais
+    que DFE_SEFAZ_SIMULTANEAS requisicoes ao mesmo tempo;
+  - 656 de uma empresa so para aquela empresa;
+  - erro (e ate SystemExit de cs.falhar) numa lane nao derruba as outras;
+  - com latencia, o paralelo leva uma fracao do tempo sequencial.
+
+Uso:
+    python scripts/testar_captura_paralela.py
+"""
+import base64
+import gzip
+import os
+import sys
+import threading
+import time
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# consulta_sefaz monta os parametros de conexao no import e exige DB_PASSWORD.
+# Aqui nada conecta no banco, entao uma senha de mentira serve.
+os.environ.setdefault('DB_PASSWORD', 'teste-offline')
+os.environ.setdefault('SECRET_KEY', 'x')
+
+from fake_sefaz import FakeSefaz  # noqa: E402
+
+LANES = 3
+SIMULTANEAS = 2
+ATRASO = 0.15
+
+fake = FakeSefaz(max_nsu=12, docs_por_lote=5, atraso=ATRASO,
+                 cnpjs_656={'33000000000656'}).iniciar()
+os.environ['DFE_SEFAZ_ENDPOINT'] = fake.url_nfe
+os.environ['DFE_SEFAZ_ENDPOINT_CTE'] = fake.url_cte
+os.environ['DFE_CAPTURA_PARALELO'] = str(LANES)
+os.environ['DFE_SEFAZ_SIMULTANEAS'] = str(SIMULTANEAS)
+
+import requests  # noqa: E402
+
+import captura_massa_dfe as cm  # noqa: E402
+import processa_dfe as pd  # noqa: E402
+
+# Sem banco: o log avulso das lanes vira uma lista.
+LOG = []
+cm._log_avulso = lambda cliente_id, cnpj, evento, **kw: LOG.append((cnpj, evento))
+
+cursores = {}
+lanes_ativas = [0, 0]   # atual, pico
+_lock = threading.Lock()
+
+
+def _fase(consultar, sess, cnpj, servico):
+    ult = 0
+    while True:
+        ret, _n = consultar(sess, cnpj, ult)
+        cstat = cm.cs._text(ret, 'cStat')
+        if cstat != '138':
+            return ult, cstat
+        lote = cm.cs._find(ret, 'loteDistDFeInt')
+        for d in lote.iter():
+            if cm.cs._local(d.tag) == 'docZip':
+                root = ET.fromstring(gzip.decompress(base64.b64decode(d.text)))
+                if servico == 'nfe':
+                    assert pd.extrair_resumo_nota(root)['emit_cnpj'] == cnpj
+        ult = pd._to_int(cm.cs._text(ret, 'ultNSU'))
+
+
+def empresa_falsa(cliente_id, documento, cert, chave_priv, cadeia, prazo):
+    """Mesmo formato de cm._capturar_empresa, com cursor em memoria."""
+    with _lock:
+        lanes_ativas[0] += 1
+        lanes_ativas[1] = max(lanes_ativas[1], lanes_ativas[0])
+    try:
+        if documento == '33000000000500':
+            raise RuntimeError('certificado corrompido')
+        if documento == '33000000000001':
+            cm.cs.falhar('HTTP != 200', 'simulado')
+        with requests.Session() as sess:
+            cursores[(documento, 'nfe')] = _fase(cm._consultar, sess, documento, 'nfe')
+            cursores[(documento, 'cte')] = _fase(cm._consultar_cte, sess, documento, 'cte')
+    finally:
+        with _lock:
+            lanes_ativas[0] -= 1
+
+
+def main():
+    boas = ['33%012d' % i for i in range(10, 16)]
+    certs = [(i, cnpj, None, None, None) for i, cnpj in enumerate(
+        boas + ['33000000000656', '33000000000500', '33000000000001'])]
+
+    t0 = time.monotonic()
+    falhas = cm._rodar_lanes(certs, prazo=time.monotonic() + 60, capturar=empresa_falsa)
+    dt = time.monotonic() - t0
+
+    for cnpj in boas:
+        assert cursores[(cnpj, 'nfe')] == (12, '137'), cursores[(cnpj, 'nfe')]
+        assert cursores[(cnpj, 'cte')] == (12, '137'), cursores[(cnpj, 'cte')]
+    print('OK  todas as empresas boas chegaram ao fim da janela (NF-e e CT-e)')
+
+    assert cursores[('33000000000656', 'nfe')] == (0, '656')
+    n_656 = [r for r in fake.requisicoes if r[1] == '33000000000656' and r[0] == 'nfe']
+    assert len(n_656) == 1, n_656
+    print('OK  656 parou so a empresa castigada, sem insistir')
+
+    assert ('33000000000500', 'erro') in LOG, LOG
+    assert falhas == ['33000000000001'], falhas
+    print('OK  erro e SystemExit numa lane nao derrubaram as outras')
+
+    assert lanes_ativas[1] <= LANES, lanes_ativas
+    assert fake.pico <= SIMULTANEAS, fake.pico
+    assert fake.pico == SIMULTANEAS, 'esperava concorrencia real na SEFAZ falsa'
+    print('OK  pico de %d lanes e %d requisicoes simultaneas (tetos %d/%d)'
+          % (lanes_ativas[1], fake.pico, LANES, SIMULTANEAS))
+
+    # 6 empresas x (3 lotes 138 + 1 137) x 2 fases + 2 do 656 = 50 consultas.
+    sequencial = len(fake.requisicoes) * ATRASO
+    assert dt < sequencial * 0.75, (dt, sequencial)
+    print('OK  %d consultas em %.2fs (sequencial levaria ~%.2fs)'
+          % (len(fake.requisicoes), dt, sequencial))
+
+    fake.parar()
+    print('\nTudo certo: lanes isoladas, tetos respeitados e log por empresa preservado.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""Mede a reconciliacao EFI contra a EFI falsa local (sem banco, sem rede).
+
+Sobe scripts/fake_efi.py em 127.0.0.1 com latencia, aponta EFI_API_BASE para
+ele e roda integrations.efi_reconcilia.reconciliar com 1 worker (equivale ao
+laco sequencial antigo) e com EFI_RECON_WORKERS. O banco e um dict em memoria
+que conta as idas ao "MySQL".
+
+Confere:
+  - os dois modos chegam ao mesmo resumo;
+  - o estado local sai em 1 SELECT por lote de ate 500 charge_ids;
+  - com latencia, o paralelo leva uma fracao do tempo sequencial.
+
+Uso:
+    python scripts/testar_efi_reconcilia.py [n_cobrancas] [atraso_seg]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault('DB_PASSWORD', 'teste-offline')
+os.environ.setdefault('SECRET_KEY', 'x')
+
+from fake_efi import FakeEfi, gerar_cobrancas  # noqa: E402
+
+from integrations import efi_reconcilia  # noqa: E402
+from utils import boletos  # noqa: E402
+
+CONFIG = {'EFI_CLIENT_ID': 'id', 'EFI_CLIENT_SECRET': 'segredo', 'EFI_SANDBOX': True}
+
+
+class Banco:
+    """cobrancas em memoria: todas pendentes, contando SELECTs e UPDATEs."""
+
+    def __init__(self, ids):
+        self.status = {str(i): 'pendente' for i in ids}
+        self.selects = self.updates = 0
+
+    def cursor(self, dictionary=False):
+        return self
+
+    def execute(self, sql, params=()):
+        if 'WHERE charge_id' in sql and sql.lstrip().startswith('SELECT'):
+            self.selects += 1
+            self._linhas = [{'id': 1, 'charge_id': c, 'status': self.status[c]}
+                            for c in params if c in self.status]
+        elif sql.lstrip().startswith('UPDATE'):
+            self.updates += 1
+            cid = params[-1]
+            self.status[cid] = 'pago' if "'pago'" in sql else 'cancelado'
+        else:
+            raise AssertionError(sql)
+
+    def fetchone(self):
+        return self._linhas[0] if self._linhas else None
+
+    def fetchall(self):
+        return self._linhas
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def rodar(fake, workers):
+    banco = Banco(c['id'] for c in fake.cobrancas)
+    efi_reconcilia.get_db_connection = lambda: banco
+    boletos._TOKEN_CACHE.clear()
+    fake.requisicoes.clear()
+    fake.pico = 0
+    t0 = time.perf_counter()
+    resumo = efi_reconcilia.reconciliar(begin_date='2000-01-01', config=CONFIG,
+                                        workers=workers)
+    seg = time.perf_counter() - t0
+    print(f"  workers={workers}: {seg:6.2f}s  http={len(fake.requisicoes)}"
+          f" pico={fake.pico}  selects={banco.selects} updates={banco.updates}")
+    return seg, resumo, banco
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 600
+    atraso = float(sys.argv[2]) if len(sys.argv) > 2 else 0.03
+    fake = FakeEfi(gerar_cobrancas(n), atraso=atraso).iniciar()
+    os.environ['EFI_API_BASE'] = fake.url
+    print(f"EFI falsa em {fake.url}: {n} cobrancas, {atraso * 1000:.0f} ms por requisicao")
+    try:
+        seq, r1, b1 = rodar(fake, 1)
+        par, r2, b2 = rodar(fake, efi_reconcilia.WORKERS)
+    finally:
+        fake.parar()
+
+    chaves = ('total_efi', 'atualizados_pagos', 'atualizados_cancelados', 'ja_corretos')
+    assert [r1[k] for k in chaves] == [r2[k] for k in chaves], (r1, r2)
+    assert b1.status == b2.status
+    lotes = -(-r1['total_efi'] // efi_reconcilia._LOTE_IN)
+    assert b1.selects == b2.selects == lotes, (b1.selects, lotes)
+    print(f"OK: mesmo resultado, {lotes} SELECT(s); paralelo {seq / par:.1f}x mais rapido")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+"""Testa o pipeline em lote do distDFe (processa_dfe.processar_lote) OFFLINE.
+
+Nao precisa de banco nem de Dropbox: um banco falso em memoria entende os
+SQL_*_UPSERT / SELECT / UPDATE que processa_dfe usa (inclusive os INSERTs de
+varias linhas), upload_xml vira um dicionario e o spool de XML vai para um
+diretorio temporario.
+
+Confere:
+  - o lote em bloco deixa as tabelas IDENTICAS ao doc a doc (processar_um_doc),
+    com bem menos idas ao banco e o de-para resolvido uma vez por rodada;
+  - evento que cancela nota do proprio lote cai no doc a doc (depende da ordem)
+    e da o mesmo resultado;
+  - linha que quebra no bloco: rollback, isola por documento, grava os docs
+    anteriores e para no que falhou (o ult_nsu nao passa dele);
+  - o lote nao fala com o Dropbox: cada XML vira arquivo no spool + linha na
+    dfe_xml_outbox, na mesma transacao do documento;
+  - falha no spool ou XML corrompido corta o lote naquele NSU;
+  - os 4 estagios (decode/parse/spool/sql) ficam cronometrados.
+
+Uso:
+    python scripts/testar_lote_dfe.py
+"""
+import base64
+import copy
+import gzip
+import os
+import re
+import shutil
+import sys
+import tempfile
+import xml.etree.ElementTree as ET
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# consulta_sefaz monta os parametros de conexao no import e exige DB_PASSWORD.
+os.environ.setdefault('DB_PASSWORD', 'teste-offline')
+os.environ.setdefault('SECRET_KEY', 'x')
+os.environ['DFE_XML_SPOOL_DIR'] = tempfile.mkdtemp(prefix='dfe_spool_')
+
+import processa_dfe as pd  # noqa: E402
+
+CNPJ = '33000000000191'
+AGORA = datetime(2026, 7, 10, 12, 0, 0)
+EXPIRA = AGORA.date()
+
+# Chave unica de cada tabela (o ON DUPLICATE KEY do banco de verdade).
+CHAVES = {
+    'dfe_documentos': ('chave',),
+    'dfe_itens': ('documento_id', 'n_item'),
+    'dfe_duplicatas': ('documento_id', 'n_dup'),
+    'dfe_cte': ('documento_id',),
+    'dfe_cte_nfe': ('documento_id', 'chave_nfe'),
+    'dfe_eventos': ('chave_evento',),
+    'dfe_xml_outbox': ('caminho',),
+}
+
+_RE_INSERT = re.compile(r"INSERT INTO (\w+)\s*\(([^)]*)\)\s*VALUES\s*(.*?)\s*"
+                        r"ON DUPLICATE KEY UPDATE(.*)$", re.S)
+
+
+class BancoFalso:
+    """Conexao + cursor pymysql (DictCursor) minimos, com commit/rollback."""
+
+    def __init__(self, depara_vendas=None, quebra_cod_anp=None):
+        self.tabelas = {t: {} for t in CHAVES}
+        self.depara_vendas = depara_vendas or {}
+        self.quebra_cod_anp = quebra_cod_anp
+        self.execucoes = 0
+        self.commits = 0
+        self._salvo = copy.deepcopy(self.tabelas)
+        self._prox_id = 1
+        self._res = []
+        self.rowcount = 0
+
+    # conexao
+    def commit(self):
+        self.commits += 1
+        self._salvo = copy.deepcopy(self.tabelas)
+
+    def rollback(self):
+        self.tabelas = copy.deepcopy(self._salvo)
+
+    # cursor
+    def fetchone(self):
+        return self._res[0] if self._res else None
+
+    def fetchall(self):
+        return list(self._res)
+
+    def execute(self, sql, params=()):
+        self.execucoes += 1
+        params = list(params)
+        self._res, self.rowcount = [], 0
+        m = _RE_INSERT.match(sql.strip())
+        if m:
+            return self._insert(m, params)
+        if sql.startswith("UPDATE dfe_documentos SET situacao='cancelada'"):
+            linha = self.tabelas['dfe_documentos'].get((params[0],))
+            if linha and (' tipo=' not in sql or linha['tipo'] == 'CTe') \
+                    and linha['situacao'] != 'cancelada':
+                linha['situacao'] = 'cancelada'
+                self.rowcount = 1
+            return
+        if sql.startswith("SELECT id FROM dfe_documentos WHERE chave = %s"):
+            linha = self.tabelas['dfe_documentos'].get((params[0],))
+            self._res = [{'id': linha['id']}] if linha else []
+            return
+        if sql.startswith("SELECT id, chave FROM dfe_documentos WHERE chave IN"):
+            docs = self.tabelas['dfe_documentos']
+            self._res = [{'id': docs[(ch,)]['id'], 'chave': ch}
+                         for ch in params if (ch,) in docs]
+            return
+        if sql.startswith("SELECT cod_anp, produto_id, COUNT(*)"):
+            for cod in params:
+                pid = self._produto_mais_comum(sql, cod)
+                if pid:
+                    self._res.append({'cod_anp': cod, 'produto_id': pid, 'n': 1})
+            return
+        if sql.startswith("SELECT produto_id FROM"):
+            pid = self._produto_mais_comum(sql, params[0])
+            self._res = [{'produto_id': pid}] if pid else []
+            return
+        raise AssertionError('SQL nao previsto no banco falso: %s' % sql[:80])
+
+    def _produto_mais_comum(self, sql, cod):
+        if 'vendas_xml_itens' in sql:
+            return self.depara_vendas.get(cod)
+        for it in self.tabelas['dfe_itens'].values():
+            if it['cod_anp'] == cod and it['produto_id']:
+                return it['produto_id']
+        return None
+
+    def _insert(self, m, params):
+        tabela = m.group(1)
+        colunas = [c.strip() for c in m.group(2).split(',')]
+        no_op = m.group(4).strip().split('=')[0] == m.group(4).strip().split('=')[1]
+        pos = 0
+        for tupla in re.findall(r"\(([^()]*)\)", m.group(3)):
+            linha = {}
+            for col, tok in zip(colunas, tupla.split(',')):
+                tok = tok.strip()
+                if tok == '%s':
+                    linha[col] = params[pos]
+                    pos += 1
+                elif tok.startswith("'"):
+                    linha[col] = tok.strip("'")
+                else:
+                    linha[col] = None if tok == 'NULL' else int(tok)
+            if tabela == 'dfe_itens' and linha['cod_anp'] == self.quebra_cod_anp:
+                raise RuntimeError('Data too long for column cod_anp')
+            chave = tuple(linha[c] for c in CHAVES[tabela])
+            atual = self.tabelas[tabela].get(chave)
+            if atual is None:
+                if tabela == 'dfe_documentos':
+                    linha['id'] = self._prox_id
+                    self._prox_id += 1
+                self.tabelas[tabela][chave] = linha
+            elif not no_op:
+                for col, v in linha.items():
+                    if col not in ('situacao', 'cliente_id', 'tipo') + CHAVES[tabela]:
+                        atual[col] = v
+        assert pos == len(params), (pos, len(params))
+
+    def cursor(self):
+        return self
+
+    def estado(self):
+        """Tabelas sem ids (o id sai na ordem de insercao, que muda no bloco).
+        Sem a outbox: o doc a doc (gravar_*) ainda sobe o XML na hora."""
+        docs = self.tabelas['dfe_documentos']
+        chave_de = {d['id']: ch for (ch,), d in docs.items()}
+        out = {}
+        for t, linhas in self.tabelas.items():
+            if t == 'dfe_xml_outbox':
+                continue
+            conv = []
+            for ln in linhas.values():
+                ln = dict(ln)
+                ln.pop('id', None)
+                if 'documento_id' in ln:
+                    ln['documento_id'] = chave_de[ln['documento_id']]
+                conv.append(tuple(sorted(ln.items(), key=lambda kv: kv[0])))
+            out[t] = sorted(conv, key=repr)
+        return out
+
+
+# --------------------------------------------------------------------------
+# docZips sinteticos
+# --------------------------------------------------------------------------
+def _chave(mod, n):
+    return ('5226%s%s001%09d1%08d' % (CNPJ, mod, n, n)).ljust(44, '0')[:44]
+
+
+def _doczip(xml, nsu, schema):
+    el = ET.Element('docZip', NSU='%015d' % nsu, schema=schema)
+    el.text = base64.b64encode(gzip.compress(xml.encode('utf-8'))).decode('ascii')
+    return el
+
+
+def _nota(nsu, n, cods):
+    dets = ''.join(
+        '<det nItem="%d"><prod><cProd>P%d</cProd><cEAN>SEM GTIN</cEAN>'
+        '<xProd>ITEM %d</xProd><NCM>27101259</NCM><cProdANP>%s</cProdANP>'
+        '<uCom>L</uCom><qCom>1000.0000</qCom><vUnCom>5.1000</vUnCom>'
+        '<vProd>5100.00</vProd></prod></det>' % (i, i, i, cod)
+        for i, cod in enumerate(cods, 1))
+    xml = ('<nfeProc xmlns="http://www.portalfiscal.inf.br/nfe"><NFe>'
+           '<infNFe Id="NFe%s"><ide><mod>55</mod><serie>1</serie><nNF>%d</nNF>'
+           '<dhEmi>2026-07-01T10:00:00-03:00</dhEmi></ide>'
+           '<emit><CNPJ>11222333000144</CNPJ><xNome>DISTRIBUIDORA</xNome></emit>'
+           '<dest><CNPJ>%s</CNPJ></dest>%s<total><ICMSTot><vNF>%d.00</vNF></ICMSTot></total>'
+           '<cobr><dup><nDup>001</nDup><dVenc>2026-07-15</dVenc><vDup>10.00</vDup></dup></cobr>'
+           '</infNFe></NFe><protNFe><infProt><cStat>100</cStat></infProt></protNFe>'
+           '</nfeProc>' % (_chave('55', n), n, CNPJ, dets, 5100 * len(cods)))
+    return _doczip(xml, nsu, 'procNFe_v4.00.xsd')
+
+
+def _resumo(nsu, n):
+    xml = ('<resNFe xmlns="http://www.portalfiscal.inf.br/nfe"><chNFe>%s</chNFe>'
+           '<CNPJ>11222333000144</CNPJ><xNome>DISTRIBUIDORA</xNome>'
+           '<dhEmi>2026-07-02T10:00:00-03:00</dhEmi><vNF>99.00</vNF>'
+           '<cSitNFe>1</cSitNFe></resNFe>' % _chave('55', n))
+    return _doczip(xml, nsu, 'resNFe_v1.01.xsd')
+
+
+def _cancelamento(nsu, n):
+    ch = _chave('55', n)
+    xml = ('<procEventoNFe xmlns="http://www.portalfiscal.inf.br/nfe"><evento>'
+           '<infEvento Id="ID110111%s01"><CNPJ>11222333000144</CNPJ>'
+           '<chNFe>%s</chNFe><dhEvento>2026-07-03T10:00:00-03:00</dhEvento>'
+           '<tpEvento>110111</tpEvento><nSeqEvento>1</nSeqEvento>'
+           '<detEvento><descEvento>Cancelamento</descEvento></detEvento>'
+           '</infEvento></evento></procEventoNFe>' % (ch, ch))
+    return _doczip(xml, nsu, 'procEventoNFe_v1.00.xsd')
+
+
+def _res_evento(nsu):
+    return _doczip('<resEvento xmlns="http://www.portalfiscal.inf.br/nfe">'
+                   '<tpEvento>210210</tpEvento></resEvento>', nsu, 'resEvento_v1.01.xsd')
+
+
+def _lote_normal():
+    docs, nsu = [], 100
+    for n in range(1, 31):
+        nsu += 1
+        docs.append(_nota(nsu, n, ['210203001', '820101034', '320102001'][: 1 + n % 3]))
+    for n in range(31, 41):
+        nsu += 1
+        docs.append(_resumo(nsu, n))
+    nsu += 1
+    docs.append(_cancelamento(nsu, 900))   # nota que nao esta no lote
+    nsu += 1
+    docs.append(_res_evento(nsu))
+    return docs
+
+
+DEPARA = {'210203001': 7, '820101034': 9}
+UPLOADS = {}
+QUEBRA_SPOOL = set()
+_guardar = pd.spool.guardar
+
+
+def _upload_falso(caminho, conteudo):
+    UPLOADS[caminho] = conteudo
+    return {}
+
+
+def _guardar_falho(caminho, conteudo):
+    if any(caminho.endswith(ch + '.xml') for ch in QUEBRA_SPOOL):
+        raise OSError(28, 'No space left on device')
+    return _guardar(caminho, conteudo)
+
+
+pd.upload_xml = _upload_falso
+pd.spool.guardar = _guardar_falho
+
+
+def _doc_a_doc(db, docs):
+    for d in docs:
+        pd.processar_um_doc(db, db, 1, CNPJ, d, AGORA, EXPIRA)
+
+
+def main():
+    pd.print = lambda *a, **k: None   # silencia os "tipo nao modelado"
+    docs = _lote_normal()
+
+    antigo = BancoFalso(DEPARA)
+    _doc_a_doc(antigo, docs)
+
+    UPLOADS.clear()
+    novo = BancoFalso(DEPARA)
+    tempos = {}
+    depara = pd.DeparaAnp()
+    resultados, erro = pd.processar_lote(novo, novo, 1, CNPJ, docs, AGORA, EXPIRA,
+                                         depara, tempos)
+    assert erro is None, erro
+    assert novo.estado() == antigo.estado()
+    assert [r[0] for r in resultados] == list(range(101, 143))
+    kinds = [r[1] for r in resultados]
+    assert kinds.count('nota') == 30 and kinds.count('resumo') == 10
+    assert kinds[-2:] == ['evento', 'outro']
+    assert novo.commits == 1
+    assert novo.execucoes * 5 < antigo.execucoes, (novo.execucoes, antigo.execucoes)
+    print('OK  bloco identico ao doc a doc: %d idas ao banco x %d, %d commit x %d'
+          % (novo.execucoes, antigo.execucoes, novo.commits, antigo.commits))
+
+    outbox = novo.tabelas['dfe_xml_outbox']
+    assert not UPLOADS, 'o lote nao pode subir nada para o Dropbox'
+    assert len(outbox) == 31 and {o['status'] for o in outbox.values()} == {'pendente'}
+    for (caminho,), o in outbox.items():
+        assert pd.spool.ler_pendente(caminho) is not None, caminho
+    ev = [o for o in outbox.values() if o['tabela'] == 'dfe_eventos']
+    assert len(ev) == 1 and ev[0]['chave'].startswith('ID110111')
+    print('OK  sem Dropbox no caminho critico: 31 XML no spool + dfe_xml_outbox')
+
+    assert set(tempos) == set(pd.ESTAGIOS)
+    print('OK  tempos por estagio: %s' % pd.formatar_tempos(tempos))
+
+    # Segundo lote da mesma rodada: de-para ja em memoria, nenhuma consulta.
+    antes = novo.execucoes
+    outro = [_nota(200 + i, 200 + i, ['210203001', '820101034']) for i in range(5)]
+    pd.processar_lote(novo, novo, 1, CNPJ, outro, AGORA, EXPIRA, depara, {})
+    assert novo.execucoes - antes == 5, novo.execucoes - antes   # docs, ids, itens, dups, outbox
+    print('OK  de-para por rodada: 2o lote sem nenhuma consulta de cod_anp')
+
+    # Evento cancelando nota do proprio lote: depende da ordem -> doc a doc.
+    ordem = [_cancelamento(1, 1), _nota(2, 1, ['210203001']),
+             _nota(3, 2, ['210203001']), _cancelamento(4, 2)]
+    a, b = BancoFalso(DEPARA), BancoFalso(DEPARA)
+    _doc_a_doc(a, ordem)
+    res, erro = pd.processar_lote(b, b, 1, CNPJ, ordem, AGORA, EXPIRA, pd.DeparaAnp())
+    assert erro is None and b.estado() == a.estado()
+    situacoes = sorted(ln['situacao'] for ln in b.tabelas['dfe_documentos'].values())
+    assert situacoes == ['autorizado', 'cancelada'], situacoes
+    assert [r[3] for r in res] == [False, False, False, True]
+    print('OK  cancelamento dentro do lote respeita a ordem de NSU')
+
+    # Linha que quebra no bloco: isola, grava ate o anterior e para.
+    ruim = docs[:5] + [_nota(106, 6, ['QUEBRA'])] + docs[6:]
+    db = BancoFalso(DEPARA, quebra_cod_anp='QUEBRA')
+    res, erro = pd.processar_lote(db, db, 1, CNPJ, ruim, AGORA, EXPIRA, pd.DeparaAnp())
+    assert erro and erro[0] == 106, erro
+    assert [r[0] for r in res] == [101, 102, 103, 104, 105]
+    assert len(db.tabelas['dfe_documentos']) == 5
+    ref = BancoFalso(DEPARA)
+    _doc_a_doc(ref, docs[:5])
+    assert db.estado() == ref.estado()
+    print('OK  falha no bloco: rollback, doc a doc, parou no NSU 106 com 101..105 gravados')
+
+    # Spool que falha (disco cheio) e XML corrompido cortam o lote no NSU certo.
+    QUEBRA_SPOOL.add(_chave('55', 4))
+    db = BancoFalso(DEPARA)
+    res, erro = pd.processar_lote(db, db, 1, CNPJ, docs, AGORA, EXPIRA, pd.DeparaAnp())
+    QUEBRA_SPOOL.clear()
+    assert erro[0] == 104 and [r[0] for r in res] == [101, 102, 103], (erro, res)
+    torto = ET.Element('docZip', NSU='%015d' % 103, schema='x')
+    torto.text = 'isto-nao-e-gzip'
+    db = BancoFalso(DEPARA)
+    res, erro = pd.processar_lote(db, db, 1, CNPJ, docs[:2] + [torto] + docs[3:],
+                                  AGORA, EXPIRA, pd.DeparaAnp())
+    assert erro[0] == 103 and [r[0] for r in res] == [101, 102], (erro, res)
+    print('OK  spool falho / docZip corrompido param o lote no NSU do problema')
+
+    shutil.rmtree(pd.spool.SPOOL_DIR, ignore_errors=True)
+    print('\nTudo certo: lote em bloco com o mesmo resultado e a mesma regra do ponteiro.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""Testa a fila de XML de DFe (integrations/dfe_xml_spool) OFFLINE.
+
+Sem banco e sem Dropbox: o lote passa por processa_dfe.processar_lote sobre o
+banco falso de testar_lote_dfe, a outbox e drenada por dfe_xml_spool.drenar
+com uma fila em memoria (mesmo contrato de FilaOutbox) e o Dropbox e o
+scripts/fake_dropbox.py.
+
+Confere:
+  - a captura nao espera o Dropbox (latencia alta no fake, lote em ms);
+  - baixar_xml le do spool enquanto o upload esta pendente;
+  - N workers sobem em paralelo (pico == workers) e o dreno leva uma fracao
+    do tempo sequencial; no fim, xml_caminho registrado e spool limpo;
+  - spool apagado (redeploy / outro container): o dreno e baixar_xml usam a
+    copia em dfe_xml_outbox.conteudo, zerada no envio;
+  - erro transitorio e retentado; Dropbox fora de vez -> 'falhou' depois de
+    MAX_TENTATIVAS; XML sem arquivo e sem copia -> continua pendente.
+
+Uso:
+    python scripts/testar_spool_dfe.py
+"""
+import os
+import shutil
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import testar_lote_dfe as tl  # noqa: E402  (ajusta env + spool temporario)
+from fake_dropbox import FakeDropbox  # noqa: E402
+
+pd = tl.pd
+spool = pd.spool
+
+from integrations.dropbox_dfe import baixar_xml  # noqa: E402
+
+WORKERS = 4
+ATRASO = 0.05
+
+
+class FilaMemoria:
+    """Mesmo contrato de dfe_xml_spool.FilaOutbox, sobre o BancoFalso."""
+
+    def __init__(self, db):
+        self.db = db
+        self.linhas = db.tabelas['dfe_xml_outbox']
+        for i, ln in enumerate(self.linhas.values(), 1):
+            ln.update(id=i, tentativas=0, proxima=0.0)
+
+    def pegar(self, limite):
+        agora = time.monotonic()
+        return [dict(ln) for ln in self.linhas.values()
+                if ln['status'] == 'pendente' and ln['proxima'] <= agora][:limite]
+
+    def concluir(self, item):
+        ln = self.linhas[(item['caminho'],)]
+        if ln['sha256'] == item['sha256']:
+            ln['status'] = 'enviado'
+            ln['conteudo'] = None
+        coluna = spool.ALVOS[item['tabela']]
+        for alvo in self.db.tabelas[item['tabela']].values():
+            if alvo[coluna] == item['chave']:
+                alvo['xml_caminho'] = item['caminho']
+        return not any(o['sha256'] == item['sha256'] and o['status'] != 'enviado'
+                       for o in self.linhas.values())
+
+    def adiar(self, item, erro, desistir=True):
+        ln = self.linhas[(item['caminho'],)]
+        ln['tentativas'] += 1
+        ln['ultimo_erro'] = str(erro)
+        desistiu = desistir and ln['tentativas'] >= spool.MAX_TENTATIVAS
+        ln['status'] = 'falhou' if desistiu else 'pendente'
+        # Sem espera no teste, salvo para quem nunca desiste: esse fica para o
+        # proximo dreno (senao drenar() nao termina).
+        ln['proxima'] = time.monotonic() + (0 if desistir else 3600)
+        return desistiu
+
+
+class ConnOutbox:
+    """So o SELECT de ler_pendente, sobre a FilaMemoria."""
+
+    def __init__(self, fila):
+        self.fila = fila
+        self._linha = None
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql, params):
+        assert sql.startswith('SELECT conteudo FROM dfe_xml_outbox'), sql
+        ln = self.fila.linhas.get((params[0],))
+        self._linha = ({'conteudo': ln['conteudo']}
+                       if ln and ln['status'] != 'enviado' else None)
+
+    def fetchone(self):
+        return self._linha
+
+    def close(self):
+        pass
+
+
+def _capturar(docs):
+    db = tl.BancoFalso(tl.DEPARA)
+    _res, erro = pd.processar_lote(db, db, 1, tl.CNPJ, docs, tl.AGORA, tl.EXPIRA,
+                                   pd.DeparaAnp())
+    assert erro is None, erro
+    for ln in db.tabelas['dfe_documentos'].values():
+        ln['xml_caminho'] = None   # so o drenador registra
+    return db
+
+
+def main():
+    pd.print = lambda *a, **k: None
+    docs = tl._lote_normal()
+
+    # A captura nao depende da latencia do Dropbox.
+    dbx = FakeDropbox(atraso=ATRASO)
+    pd.upload_xml = dbx.upload_xml
+    t0 = time.monotonic()
+    db = _capturar(docs)
+    dt_captura = time.monotonic() - t0
+    fila = FilaMemoria(db)
+    n = len(fila.linhas)
+    assert not dbx.uploads and dt_captura < n * ATRASO / 2, dt_captura
+    print('OK  lote de %d docs gravado em %.3fs sem esperar o Dropbox (%d XML na fila)'
+          % (len(docs), dt_captura, n))
+
+    # Leitores enxergam o XML enquanto o upload esta pendente.
+    caminho = next(iter(fila.linhas))[0]
+    xml = baixar_xml(caminho)
+    assert xml is not None and xml == spool.ler_pendente(caminho)
+    assert xml.startswith(b'<nfeProc')
+    print('OK  baixar_xml le do spool enquanto o upload esta pendente')
+
+    # Dreno com N workers.
+    t0 = time.monotonic()
+    stats = spool.drenar(fila, dbx.upload_xml, workers=WORKERS)
+    dt = time.monotonic() - t0
+    assert stats == {'enviados': n, 'falhas': 0, 'desistidos': 0}, stats
+    assert dbx.pico == WORKERS, dbx.pico
+    assert dt < n * ATRASO / 2, (dt, n * ATRASO)
+    for (cam,), ln in fila.linhas.items():
+        assert ln['status'] == 'enviado'
+        assert dbx.arquivos[cam] and spool.ler_pendente(cam) is None
+    com_caminho = [d for d in db.tabelas['dfe_documentos'].values() if d['xml_caminho']]
+    assert len(com_caminho) == 30   # as 30 notas; resumo nao tem XML
+    assert all(e['xml_caminho'] for e in db.tabelas['dfe_eventos'].values())
+    restos = [f for _r, _d, fs in os.walk(spool.SPOOL_DIR) for f in fs]
+    assert not restos, restos[:3]
+    print('OK  %d XML em %.2fs com %d workers (sequencial ~%.2fs); xml_caminho '
+          'registrado e spool limpo' % (n, dt, WORKERS, n * ATRASO))
+
+    # Erro transitorio: retenta e sobe.
+    db = _capturar(docs[:3])
+    fila = FilaMemoria(db)
+    alvo = next(iter(fila.linhas))[0]
+    dbx = FakeDropbox(falhas={alvo: 2})
+    stats = spool.drenar(fila, dbx.upload_xml, workers=2)
+    assert stats == {'enviados': 3, 'falhas': 2, 'desistidos': 0}, stats
+    assert fila.linhas[(alvo,)]['tentativas'] == 2 and alvo in dbx.arquivos
+    print('OK  erro transitorio do Dropbox: retentado e enviado')
+
+    # Spool apagado (container recriado / web em outro container): o XML vem
+    # da copia no banco, para o leitor e para o dreno.
+    db = _capturar(docs[:3])
+    fila = FilaMemoria(db)
+    shutil.rmtree(spool.SPOOL_DIR)
+    caminho = next(iter(fila.linhas))[0]
+    assert spool.ler_pendente(caminho) is None
+    xml = baixar_xml(caminho, ConnOutbox(fila))
+    assert xml is not None and xml.startswith(b'<')
+    dbx = FakeDropbox()
+    stats = spool.drenar(fila, dbx.upload_xml, workers=2)
+    assert stats == {'enviados': 3, 'falhas': 0, 'desistidos': 0}, stats
+    assert dbx.arquivos[caminho] == xml
+    assert all(ln['conteudo'] is None for ln in fila.linhas.values())
+    print('OK  spool apagado: baixar_xml e o dreno usam dfe_xml_outbox.conteudo')
+
+    # Dropbox fora de vez; XML sem arquivo e sem copia no banco.
+    db = _capturar(docs[:2])
+    fila = FilaMemoria(db)
+    fora, sumido = [c for (c,) in fila.linhas]
+    sha_sumido = fila.linhas[(sumido,)]['sha256']
+    os.remove(spool._arquivo(sha_sumido))
+    fila.linhas[(sumido,)]['conteudo'] = None
+    dbx = FakeDropbox(falhas={fora: 999})
+    spool.MAX_TENTATIVAS, max_tent = 1, spool.MAX_TENTATIVAS
+    for _ in range(2):   # o sumido volta a cada dreno e nunca desiste
+        fila.linhas[(sumido,)]['proxima'] = 0.0
+        stats = spool.drenar(fila, dbx.upload_xml, workers=2)
+        assert stats['enviados'] == 0, stats
+    spool.MAX_TENTATIVAS = max_tent
+    assert fila.linhas[(fora,)]['status'] == 'falhou'
+    assert fila.linhas[(sumido,)]['status'] == 'pendente'
+    assert fila.linhas[(sumido,)]['tentativas'] == 2
+    assert 'sem copia no banco' in fila.linhas[(sumido,)]['ultimo_erro']
+    assert spool.ler_pendente(fora) is not None   # continua no disco p/ reprocessar
+    print('OK  Dropbox fora: desiste apos MAX_TENTATIVAS; XML sem copia: segue pendente')
+
+    shutil.rmtree(spool.SPOOL_DIR, ignore_errors=True)
+    print('\nTudo certo: captura desacoplada do Dropbox, fila duravel e retentativas.')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,21 @@
 #!/bin/bash
-# Script para limpar cache Python e iniciar a aplicação
-
-echo "Limpando cache Python..."
-find . -type d -name "__pycache__" -exec rm -rf {} + 2>/dev/null || true
-find . -type f -name "*.pyc" -delete 2>/dev/null || true
-find . -type f -name "*.pyo" -delete 2>/dev/null || true
+# Script para iniciar a aplicação.
+#
+# `bash start.sh` sobe o gunicorn (processo web); `bash start.sh scheduler`
+# sobe o processo do agendador (integrations/agendador.py), que roda os jobs
+# periodicos. Os dois precisam do certificado EFI decodificado abaixo.
+#
+# O __pycache__ NAO e mais apagado a cada boot: o .pyc guarda o mtime/tamanho
+# do .py de origem e o Python recompila sozinho o que mudou no deploy. Apagar
+# so fazia todo worker recompilar os 50+ modulos de rotas a cada restart.
+# Para forcar a limpeza (diagnostico): LIMPAR_PYCACHE=1.
+if [ "${LIMPAR_PYCACHE:-0}" = "1" ]; then
+  echo "Limpando cache Python..."
+  find . -type d -name "__pycache__" -exec rm -rf {} + 2>/dev/null || true
+  find . -type f -name "*.py[co]" -delete 2>/dev/null || true
+fi
 
-echo "Cache limpo! Iniciando aplicação..."
+echo "Iniciando aplicação..."
 
 # --- recria certificado P12 a partir do secret EFI_CERT_B64 (se existir) ---
 # destino pode ser sobrescrito pela variável EFI_CERT_PATH
@@ -31,4 +40,26 @@ if [ -n "${EFI_CERT_B64:-}" ] || [ -n "${EFI_CERT_B64_1:-}" ] || [ -n "${EFI_CER
 fi
 # ----------------------------------------------------------------------
 
-exec gunicorn app:app --bind 0.0.0.0:${PORT:-8080} --workers 2 --timeout 300
+if [ "${1:-web}" = "scheduler" ]; then
+  exec python -m integrations.agendador
+fi
+
+# gthread: o stream SSE de /estoque/tempo-real/stream fica aberto e ocuparia um
+# worker sync inteiro; com threads ele ocupa uma thread (teto por processo em
+# ESTOQUE_TR_MAX_STREAMS, abaixo de GUNICORN_THREADS).
+#
+# O pool do MySQL (utils/db.py) e por processo e precisa acompanhar as
+# threads: cada request segura uma conexao, e alem delas ha a thread de
+# manutencao da partida, a do saldo em tempo real e a conexao de leitura em
+# lote da exportacao contabil. Pool menor que isso cai na conexao direta sem
+# pool (fallbacks em /debug/db-pool). Sem DB_POOL_SIZE no ambiente, vale
+# threads + 4; o mysql-connector nao aceita mais que 32.
+GUNICORN_THREADS="${GUNICORN_THREADS:-8}"
+if [ -z "${DB_POOL_SIZE:-}" ]; then
+  DB_POOL_SIZE=$((GUNICORN_THREADS + 4))
+  [ "$DB_POOL_SIZE" -gt 32 ] && DB_POOL_SIZE=32
+fi
+export DB_POOL_SIZE
+echo "gunicorn: ${GUNICORN_THREADS} threads por worker, DB_POOL_SIZE=${DB_POOL_SIZE}"
+exec gunicorn app:app --bind 0.0.0.0:${PORT:-8080} --workers 2 \
+     --worker-class gthread --threads ${GUNICORN_THREADS} --timeout 300
@@ -0,0 +1,192 @@
+import threading
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from integrations import agendador
+from integrations.agendador import Agendador, Job, resultado
+
+
+class _Banco:
+    """agendador_execucoes e agendador_jobs em memória, só o SQL do agendador."""
+
+    def __init__(self):
+        self.execucoes = {}   # id -> dict
+        self.jobs = {}        # job -> dict
+        self._lock = threading.Lock()
+
+    def conectar(self):
+        return _Conn(self)
+
+
+class _Conn:
+    def __init__(self, banco):
+        self.banco = banco
+        self.lastrowid = None
+        self.rowcount = 0
+        self._linhas = []
+
+    def cursor(self):
+        return self
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+    def _novo(self, **campos):
+        ex = self.banco.execucoes
+        self.lastrowid = max(ex, default=0) + 1
+        ex[self.lastrowid] = dict(campos, id=self.lastrowid)
+
+    def execute(self, sql, params=()):
+        ex = self.banco.execucoes
+        with self.banco._lock:
+            if sql.startswith("SELECT id FROM agendador_execucoes"):
+                self._linhas = [(i,) for i, e in sorted(ex.items())
+                                if e['job'] == params[0] and e['status'] == 'fila']
+            elif sql.startswith("SELECT id, job, origem FROM agendador_execucoes"):
+                self._linhas = [(i, e['job'], e['origem']) for i, e in sorted(ex.items())
+                                if e['status'] == 'fila']
+            elif sql.startswith("INSERT INTO agendador_execucoes") and "'fila'" in sql:
+                self._novo(job=params[0], origem=params[1], status='fila', pedido_por=params[2])
+            elif sql.startswith("INSERT INTO agendador_execucoes"):
+                self._novo(job=params[0], origem=params[1], status='rodando',
+                           processo=params[2], inicio=datetime.now(), visto_em=None)
+            elif sql.startswith("UPDATE agendador_execucoes SET status = 'rodando'"):
+                e = ex.get(params[1])
+                self.rowcount = int(bool(e and e['status'] == 'fila'))
+                if self.rowcount:
+                    e.update(status='rodando', processo=params[0], inicio=datetime.now())
+            elif sql.startswith("UPDATE agendador_execucoes SET visto_em = NOW()"):
+                for e in ex.values():
+                    if e['status'] == 'rodando' and e.get('processo') == params[0]:
+                        e['visto_em'] = datetime.now()
+            elif sql.startswith("UPDATE agendador_execucoes SET status = 'erro'"):
+                processo, vivo_seg = params
+                limite = datetime.now() - timedelta(seconds=vivo_seg)
+                for e in ex.values():
+                    visto = e.get('visto_em') or e.get('inicio')
+                    if (e['status'] == 'rodando' and e.get('processo') != processo
+                            and (visto is None or visto < limite)):
+                        e['status'] = 'erro'
+            elif sql.startswith("UPDATE agendador_execucoes SET status = %s"):
+                status, ms, linhas, detalhe, i = params
+                ex[i].update(status=status, duracao_ms=ms, linhas=linhas, detalhe=detalhe)
+            elif sql.startswith("INSERT INTO agendador_jobs") and 'ultimo_status' in sql:
+                job, status, ms, linhas, falha, proxima = params
+                j = self.banco.jobs.setdefault(job, {'execucoes': 0, 'falhas': 0})
+                j.update(ultimo_status=status, ultima_duracao_ms=ms, ultimas_linhas=linhas,
+                         proxima_execucao=proxima)
+                j['execucoes'] += 1
+                j['falhas'] += falha
+            elif sql.startswith("INSERT INTO agendador_jobs"):
+                job, descricao, agenda, automatico, proxima = params
+                self.banco.jobs.setdefault(job, {'execucoes': 0, 'falhas': 0}).update(
+                    agenda=agenda, automatico=automatico, proxima_execucao=proxima)
+            else:
+                raise AssertionError(sql)
+
+    def fetchone(self):
+        return self._linhas[0] if self._linhas else None
+
+    def fetchall(self):
+        return self._linhas
+
+
+_APP = SimpleNamespace(logger=SimpleNamespace(
+    info=lambda *a, **k: None, warning=lambda *a, **k: None,
+    exception=lambda *a, **k: None))
+
+
+def _agendador(banco, *jobs):
+    return Agendador(_APP, jobs, conectar=banco.conectar)
+
+
+def test_fila_nao_duplica_e_roda_com_origem_manual():
+    banco = _Banco()
+    chamadas = []
+    job = Job('importa', lambda app, origem: chamadas.append(origem) or resultado(linhas=7),
+              'cron', minute='*/10')
+    ag = _agendador(banco, job)
+
+    id1, novo1 = agendador.enfileirar('importa', pedido_por='ana', conn=banco.conectar())
+    id2, novo2 = agendador.enfileirar('importa', pedido_por='bia', conn=banco.conectar())
+    assert (id1, novo1, novo2) == (id2, True, False)
+
+    for t in ag.processar_fila():
+        t.join(5)
+    assert chamadas == ['manual']
+    assert banco.execucoes[id1]['status'] == 'ok'
+    assert banco.execucoes[id1]['linhas'] == 7
+    assert banco.jobs['importa']['execucoes'] == 1
+    assert ag.processar_fila() == []               # nada mais na fila
+
+
+def test_sobreposicao_vira_pulado_e_excecao_vira_erro():
+    banco = _Banco()
+    entrou, solta = threading.Event(), threading.Event()
+
+    def lento(app, origem):
+        entrou.set()
+        solta.wait(5)
+
+    def quebra(app, origem):
+        raise RuntimeError('IMAP fora')
+
+    ag = _agendador(banco, Job('lento', lento, 'interval', minutes=5),
+                    Job('quebra', quebra, 'interval', minutes=5))
+    t = threading.Thread(target=ag.executar, args=('lento',))
+    t.start()
+    assert entrou.wait(5)
+    assert ag.executar('lento', origem='manual') == 'pulado'
+    solta.set()
+    t.join(5)
+    assert sorted(e['status'] for e in banco.execucoes.values()) == ['ok', 'pulado']
+
+    assert ag.executar('quebra') == 'erro'
+    erro = [e for e in banco.execucoes.values() if e['job'] == 'quebra'][0]
+    assert 'IMAP fora' in erro['detalhe']
+    assert banco.jobs['quebra']['falhas'] == 1
+
+
+def test_registro_e_proxima_execucao(monkeypatch):
+    monkeypatch.setenv('EFI_SCHED_ENABLED', '0')
+    jobs = agendador.registro()
+    nomes = [j.nome for j in jobs]
+    assert len(nomes) == len(set(nomes))
+    assert {'dfe_captura', 'dfe_xml_outbox', 'els_email_import', 'efi_reconcilia',
+            'dashboard_metricas', 'agendador_limpeza'} <= set(nomes)
+
+    banco = _Banco()
+    ag = Agendador(_APP, jobs, conectar=banco.conectar)
+    ag.iniciar()
+    try:
+        assert banco.jobs['dashboard_metricas']['proxima_execucao'] is not None
+        assert banco.jobs['efi_reconcilia']['proxima_execucao'] is None   # só manual
+        assert banco.jobs['efi_reconcilia']['agenda'] == 'só manual'
+    finally:
+        ag.parar()
+
+
+def test_orfas_so_de_processo_sem_batimento():
+    banco = _Banco()
+    agora = datetime.now()
+    velho = agora - timedelta(seconds=agendador.VIVO_SEG + 60)
+    banco.execucoes = {
+        1: {'id': 1, 'job': 'a', 'status': 'rodando', 'processo': 'antigo:1',
+            'inicio': velho, 'visto_em': agora},        # deploy: ainda de pé
+        2: {'id': 2, 'job': 'b', 'status': 'rodando', 'processo': 'morto:2',
+            'inicio': velho, 'visto_em': velho},
+        3: {'id': 3, 'job': 'c', 'status': 'rodando', 'processo': 'morto:3',
+            'inicio': velho, 'visto_em': None},
+        4: {'id': 4, 'job': 'd', 'status': 'rodando', 'processo': agendador.PROCESSO,
+            'inicio': velho, 'visto_em': velho},
+    }
+    ag = _agendador(banco)
+    ag.batimento()
+    assert banco.execucoes[4]['visto_em'] > velho
+
+    ag._encerrar_orfas()
+    status = {i: e['status'] for i, e in banco.execucoes.items()}
+    assert status == {1: 'rodando', 2: 'erro', 3: 'erro', 4: 'rodando'}
@@ -0,0 +1,125 @@
+import os
+import time
+
+import pytest
+from flask import Flask
+
+from utils import boleto_cache
+
+PDF = b"%PDF-1.4\n" + b"x" * 4000
+
+
+class _Resp:
+    def __init__(self, corpo, status=200):
+        self.status_code = status
+        self._corpo = corpo
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self._corpo), chunk_size):
+            yield self._corpo[i:i + chunk_size]
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(boleto_cache, 'CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(boleto_cache, '_disponivel', None)
+    chamadas = []
+
+    def fetch(cred, url):
+        chamadas.append(url)
+        return _Resp(fetch.corpo)
+
+    fetch.corpo = PDF
+    monkeypatch.setattr(boleto_cache, 'fetch_boleto_pdf_stream', fetch)
+    return fetch, chamadas
+
+
+def test_segunda_visualizacao_nao_vai_ao_provedor_e_etag_da_304(cache):
+    fetch, chamadas = cache
+    a = boleto_cache.buscar({}, 123, 'https://efi/pdf/123')
+    b = boleto_cache.buscar({}, 123, 'https://efi/pdf/123')
+    assert chamadas == ['https://efi/pdf/123']
+    assert a == b and a.tamanho == len(PDF)
+
+    app = Flask(__name__)
+    from routes.financeiro import _enviar_pdf
+    with app.test_request_context(headers={'If-None-Match': '"%s"' % a.etag}):
+        resp = _enviar_pdf(a, 'boleto_123.pdf', False)
+        assert resp.status_code == 304
+        assert 'private' in resp.headers['Cache-Control']
+    with app.test_request_context():
+        resp = _enviar_pdf(a, 'boleto_123.pdf', True)
+        assert resp.status_code == 200 and resp.get_etag()[0] == a.etag
+
+    # vencimento prorrogado: invalidar -> busca de novo, conteúdo novo, ETag novo
+    fetch.corpo = PDF + b"novo"
+    boleto_cache.invalidar(123)
+    c = boleto_cache.buscar({}, 123, 'https://efi/pdf/123')
+    assert len(chamadas) == 2 and c.etag != a.etag
+    assert os.listdir(os.path.dirname(c.caminho)) == [os.path.basename(c.caminho)]
+
+
+def test_html_do_provedor_nao_entra_e_arquivo_local_entra(cache, tmp_path):
+    fetch, chamadas = cache
+    fetch.corpo = b"<html>erro</html>"
+    assert boleto_cache.buscar({}, 7, 'https://efi/pdf/7') is None
+    assert boleto_cache.obter(7) is None
+    assert not [n for n in os.listdir(tmp_path / '7') if not n.endswith('.pdf')]   # sem .tmp
+
+    local = tmp_path / 'boleto_8.pdf'
+    local.write_bytes(PDF)
+    t = boleto_cache.prefetch({}, 8, str(local))
+    t.join(5)
+    assert boleto_cache.obter(8).tamanho == len(PDF) and len(chamadas) == 1
+
+
+def test_despejo_lru_pelo_uso(cache):
+    for cid in (1, 2, 3):
+        boleto_cache.guardar(cid, [PDF + bytes([cid])])
+    velho = time.time() - 100
+    for cid in (1, 2, 3):
+        os.utime(boleto_cache.obter(cid).caminho, (velho + cid, velho + cid))
+    boleto_cache.obter(1)                         # 1 foi usado agora: fica
+    assert boleto_cache.despejar(limite=2 * len(PDF) + 10) == 2
+    assert boleto_cache.obter(1) and not boleto_cache.obter(2) and not boleto_cache.obter(3)
+
+
+def test_download_cai_no_proxy_quando_o_cache_nao_guarda(cache, monkeypatch):
+    import routes.financeiro as fin
+
+    fetch, chamadas = cache
+    fetch.corpo = b"<html>instavel</html>"     # cache recusa; o proxy repassa
+
+    class _Cur:
+        def execute(self, *a):
+            pass
+
+        def fetchone(self):
+            return {'pdf_boleto': None, 'link_boleto': 'https://efi/pdf/5',
+                    'data_vencimento': None, 'nome_fantasia': 'Posto X',
+                    'razao_social': None}
+
+        def close(self):
+            pass
+
+    class _Conn:
+        def cursor(self, dictionary=False):
+            return _Cur()
+
+        def close(self):
+            pass
+
+    monkeypatch.setattr(fin, 'get_db_connection', _Conn)
+    monkeypatch.setattr(fin, '_get_efi_credentials', lambda: {})
+    monkeypatch.setattr(fin, 'fetch_boleto_pdf_stream', fetch)
+
+    app = Flask(__name__)
+    app.config['LOGIN_DISABLED'] = True
+    with app.test_request_context():
+        resp = fin.download_boleto(5)
+        assert resp.status_code == 200
+        assert b''.join(resp.response) == fetch.corpo
+    assert chamadas == ['https://efi/pdf/5', 'https://efi/pdf/5']
@@ -0,0 +1,48 @@
+from datetime import date, timedelta
+
+from routes.conf_cartoes import _build_report, _next_business_day
+from utils.dias_uteis import CalendarioUteis
+
+FERIADOS = {'2026-04-03', '2026-04-21', '2026-05-01', '2026-06-04', 'lixo'}
+
+
+def test_calendario_igual_ao_laco_dia_a_dia():
+    inicio = date(2026, 3, 20)
+    cal = CalendarioUteis(FERIADOS, inicio, date(2026, 4, 10))
+    for i in range(90):                     # passa do fim: o array cresce
+        d = inicio + timedelta(days=i)
+        for n in (0, 1, 2, 5, 30, 61):
+            assert cal.somar(d, n) == _next_business_day(d, n, FERIADOS), (d, n)
+    antes = date(2026, 3, 1)                # antes do início: cai no laço
+    assert cal.somar(antes, 3) == _next_business_day(antes, 3, FERIADOS)
+    assert not cal.eh_util(date(2026, 4, 21)) and cal.eh_util(date(2026, 4, 22))
+
+
+def test_ciclos_por_bandeira_com_feriado():
+    bandeiras = [
+        {'id': 1, 'nome': 'Visa', 'tipo': 'CREDITO', 'prazo_compensacao_dias': 1,
+         'saldo_anterior': 0.0, 'vinculos': [{'forma_recebimento_id': 10,
+                                              'forma_recebimento_nome': 'Visa Cred'}]},
+        {'id': 2, 'nome': 'Elo', 'tipo': 'DEBITO', 'prazo_compensacao_dias': 0,
+         'saldo_anterior': 0.0, 'vinculos': []},
+    ]
+    vendas = [
+        {'data_venda': date(2026, 4, 17), 'bandeira_id': 1, 'total_venda': 100},   # sex
+        {'data_venda': date(2026, 4, 18), 'bandeira_id': 1, 'total_venda': 50},    # sáb
+        {'data_venda': date(2026, 4, 20), 'bandeira_id': 1, 'total_venda': 30},    # seg
+        {'data_venda': date(2026, 4, 20), 'bandeira_id': 2, 'total_venda': 7},
+    ]
+    receb = [{'data_recebimento': date(2026, 4, 20), 'forma_id': 10, 'total_recebimento': 147}]
+    report, venda, recebido, _dif, _saldo = _build_report(
+        bandeiras, {1: [10], 2: []}, vendas, receb, FERIADOS, date(2026, 4, 18))
+
+    visa, elo = report
+    # sex -> seg 20 (1 dia útil); sáb também; seg 20 -> qua 22 (21 é feriado).
+    # A venda de sexta é pré-período mas cai dentro da janela.
+    assert [(l['data_iso'], l['data_recebimento']) for l in visa['linhas']] == [
+        ('2026-04-17', '20/04/2026'), ('2026-04-18', '20/04/2026'),
+        ('2026-04-20', '22/04/2026')]
+    assert visa['linhas'][0]['is_preperiodo'] and visa['linhas'][1]['is_destaque']
+    assert visa['linhas'][1]['diferenca'] == 3.0          # 150 vendido, 147 recebido
+    assert elo['linhas'][0]['data_recebimento'] == '20/04/2026'   # prazo 0
+    assert (venda, recebido) == (187.0, 147.0)
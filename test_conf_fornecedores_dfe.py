@@ -0,0 +1,187 @@
+import copy
+import os
+import random
+import sys
+
+from routes import conf_fornecedores_dfe as mod
+from routes.conf_fornecedores_dfe import _aloca_fifo, _meses_inteiros
+
+# a versão antiga (referência) vive no benchmark
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripts'))
+from bench_conf_fornecedores_dfe import _aloca_fifo_lista  # noqa: E402
+
+
+def _linhas(rnd, n):
+    """Linha do tempo sintética no formato de _monta (já ordenada)."""
+    linhas = []
+    for i in range(n):
+        sorte = rnd.random()
+        if sorte < 0.55:
+            l = {'tipo': 'nota', 'valor': round(rnd.uniform(10, 50000), 2)}
+            if rnd.random() < 0.2:
+                l['vinc_total'] = round(l['valor'] * rnd.choice((0.5, 1.0, 1.2)), 2)
+            if rnd.random() < 0.1:
+                l['quitado_pre'] = round(rnd.uniform(0, l['valor']), 2)
+        elif sorte < 0.95:
+            l = {'tipo': 'pagamento', 'valor': round(rnd.uniform(1, 60000), 2),
+                 'usado': round(rnd.uniform(0, 500), 2) if rnd.random() < 0.2 else 0.0}
+            if rnd.random() < 0.05:
+                l['dev_abatido'] = l['valor']
+        else:
+            l = {'tipo': 'devolucao', 'valor': round(rnd.uniform(1, 3000), 2)}
+            if rnd.random() < 0.3:
+                l['abatida_de'] = '2026-03-01'
+        l['id'] = i
+        linhas.append(l)
+    return linhas
+
+
+def test_deque_igual_a_lista_em_linhas_aleatorias():
+    rnd = random.Random(7)
+    for _ in range(300):
+        linhas = _linhas(rnd, rnd.randrange(0, 80))
+        saldo_ant = rnd.choice((0.0, round(rnd.uniform(-80000, 80000), 2), 0.004, -0.004))
+        a, b = copy.deepcopy(linhas), copy.deepcopy(linhas)
+        assert _aloca_fifo(a, saldo_ant) == _aloca_fifo_lista(b, saldo_ant)
+        assert a == b                      # mesmas faltas e marcas coberta/parcial
+
+
+def test_invariante_e_marcas():
+    linhas = [
+        {'tipo': 'nota', 'valor': 100.0},
+        {'tipo': 'nota', 'valor': 50.0},
+        {'tipo': 'pagamento', 'valor': 120.0},
+        {'tipo': 'nota', 'valor': 30.0},
+        {'tipo': 'devolucao', 'valor': 10.0},
+        {'tipo': 'pagamento', 'valor': 100.0},
+    ]
+    saldo_ant = -20.0
+    sobra, descoberto = _aloca_fifo(linhas, saldo_ant)
+    periodo = 120.0 + 100.0 - 10.0 - 100.0 - 50.0 - 30.0
+    assert abs((sobra - descoberto) - (periodo + saldo_ant)) < 1e-9
+    assert [(l['coberta'], l['parcial']) for l in linhas if l['tipo'] == 'nota'] == [
+        (True, False), (True, False), (True, False)]
+    assert (sobra, descoberto) == (10.0, 0.0)
+
+    linhas = [{'tipo': 'nota', 'valor': 100.0}, {'tipo': 'nota', 'valor': 50.0},
+              {'tipo': 'pagamento', 'valor': 120.0}]
+    assert _aloca_fifo(linhas, 0.0) == (0.0, 30.0)
+    assert [(l['falta'], l['coberta'], l['parcial']) for l in linhas[:2]] == [
+        (0.0, True, False), (30.0, False, True)]
+
+
+def test_meses_inteiros():
+    assert _meses_inteiros('2026-07-07', '2026-07-31') == []
+    assert _meses_inteiros('2026-07-07', '2026-08-01') == ['2026-07']
+    assert _meses_inteiros('2026-11-15', '2027-02-10') == ['2026-11', '2026-12', '2027-01']
+
+
+class _Conn:
+    """Razão em memória: meses limpos e o resultado da soma por fornecedor."""
+
+    def __init__(self, limpos, somas):
+        self.limpos, self.somas, self.rollbacks = limpos, somas, 0
+
+    def cursor(self, dictionary=False):
+        conn = self
+
+        class _Cur:
+            def execute(self, sql, params=()):
+                if 'FROM dfe_razao_marcas' in sql:
+                    self.rows = [(None,)]
+                elif 'FROM dfe_razao_meses' in sql:
+                    self.rows = [(m,) for m in conn.limpos]
+                else:
+                    self.rows = conn.somas
+
+            def fetchone(self):
+                return self.rows[0]
+
+            def fetchall(self):
+                return self.rows
+
+            def close(self):
+                pass
+        return _Cur()
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def commit(self):
+        pass
+
+
+def test_saldos_anteriores_razao_mais_mes_parcial(monkeypatch):
+    refeitos, janelas = [], []
+    monkeypatch.setattr(mod, '_gatilhos_razao_ativos', lambda conn: True)
+    monkeypatch.setattr(mod, '_razao_recalcula_mes', lambda conn, mes: refeitos.append(mes))
+
+    def ao_vivo(total):
+        def consulta(conn, data_ini, empresa_ids, fornecedor_ids, desde):
+            janelas.append((desde, data_ini))
+            return {1: total, 3: total}
+        return consulta
+    monkeypatch.setattr(mod, '_notas_anteriores', ao_vivo(10.0))
+    monkeypatch.setattr(mod, '_pagamentos_anteriores', ao_vivo(4.0))
+    monkeypatch.setattr(mod, '_devolucoes_anteriores', ao_vivo(1.0))
+
+    conn = _Conn(limpos=['2026-07', '2026-09'],
+                 somas=[{'fornecedor_id': 1, 'notas': 100, 'pagos': 60},
+                        {'fornecedor_id': 2, 'notas': 5, 'pagos': None}])
+    notas, pagos = mod._saldos_anteriores(conn, '2026-10-15', [], [])
+    assert refeitos == ['2026-08']                       # só o mês sujo/ausente
+    assert janelas == [('2026-10-01', '2026-10-15')] * 3  # ao vivo só o pedaço do mês
+    assert notas == {1: 110.0, 2: 5.0, 3: 10.0}
+    assert pagos == {1: 63.0, 2: 0.0, 3: 3.0}
+
+    # No 1º dia do mês não sobra pedaço ao vivo
+    janelas.clear()
+    mod._saldos_anteriores(conn, '2026-10-01', [], [])
+    assert janelas == []
+
+
+def test_saldos_anteriores_sem_razao_volta_ao_historico(monkeypatch):
+    janelas = []
+    monkeypatch.setattr(mod, '_gatilhos_razao_ativos', lambda conn: False)
+    for nome in ('_notas_anteriores', '_pagamentos_anteriores', '_devolucoes_anteriores'):
+        monkeypatch.setattr(mod, nome, lambda conn, data_ini, e, f, desde: janelas.append(desde) or {})
+    assert mod._saldos_anteriores(_Conn([], []), '2026-10-15', [], []) == ({}, {})
+    assert janelas == [mod.DATA_CORTE_DFE] * 3
+
+
+def test_tela_nao_cria_gatilho_e_nao_reconsulta_a_cada_abertura(monkeypatch):
+    sqls = []
+
+    class _SemGatilho:
+        def cursor(self):
+            return self
+
+        def execute(self, sql, params=()):
+            sqls.append(sql)
+
+        def fetchone(self):
+            return (0,)
+
+        def close(self):
+            pass
+
+    monkeypatch.setattr(mod, '_razao_ativo', False)
+    monkeypatch.setattr(mod, '_razao_falhou_em', None)
+    assert mod._gatilhos_razao_ativos(_SemGatilho()) is False
+    assert not [q for q in sqls if 'TRIGGER' in q and 'information_schema' not in q]
+    assert mod._gatilhos_razao_ativos(_SemGatilho()) is False
+    assert len(sqls) == 1
+
+    monkeypatch.setattr(mod, '_razao_falhou_em',
+                        mod._razao_falhou_em - mod._RAZAO_RETENTAR_SEG - 1)
+    assert mod._gatilhos_razao_ativos(_SemGatilho()) is False
+    assert len(sqls) == 2
+
+
+def test_gatilho_do_extrato_nao_grava_na_linha_do_mes():
+    # Só INSERT em dfe_razao_marcas: o upsert em dfe_razao_meses prendia a
+    # linha do mês durante a importação inteira de um OFX.
+    for nome, ddl in mod._gatilhos_razao():
+        if 'bank_transactions' in nome or 'dfe_' in nome.replace('razao_dfe_', ''):
+            assert 'dfe_razao_meses' not in ddl, nome
+            assert 'INSERT INTO dfe_razao_marcas' in ddl, nome
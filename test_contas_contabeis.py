@@ -0,0 +1,103 @@
+import itertools
+
+import pytest
+
+from routes.bank_import import _resolver_contas_contabeis
+from utils import contas_contabeis
+from utils.contas_contabeis import Resolvedor
+
+MAPAS = {
+    'coligada': {
+        (11, 2): {'debito': ('1.9.2', 'MUTUO 2'), 'credito': ('2.9.2', 'MUTUO PAGAR 2')},
+        (12, 2): {'debito': ('1.8.2', 'OUTRA CONTA 2'), 'credito': ('', '')},
+        (21, 1): {'debito': ('', ''), 'credito': ('2.9.1', 'MUTUO PAGAR 1')},
+    },
+    'categoria': {(5, 1): ('5.2.005', 'ENERGIA'), (6, 1): ('', 'SEM CODIGO')},
+    'fornecedor': {(7, 1): ('', 'FORN SEM CODIGO'), (8, 1): ('2.1.008', 'FORN 8')},
+    'cnpj': {('00000000000007', 1): ('2.2.007', 'FORN CNPJ 7')},
+    'troco_pix': {1: ('3.1.1', 'TROCO PIX')},
+    'cartao': {},
+}
+
+
+@pytest.fixture(autouse=True)
+def _limpo():
+    contas_contabeis.limpar()
+    yield
+    contas_contabeis.limpar()
+
+
+def _linhas():
+    """Combinações dos campos que decidem cada ramo da regra."""
+    base = {'conta_banco_codigo': '1.1.1', 'conta_banco_nome': 'BANCO', 'banco_cliente_id': 1,
+            'conta_destino_codigo': '1.1.2', 'conta_destino_nome': 'BANCO DESTINO',
+            'conta_origem_codigo': '', 'conta_origem_nome': 'ORIGEM SEM PLANO',
+            'conta_fr_codigo': '4.2.1', 'conta_fr_nome': 'RECEITA PIX'}
+    for bt_id, (tipo, conc, account_id, outra, dest_ba, forn, cnpj, cats) in enumerate(itertools.product(
+            ('DEBIT', 'CREDIT'), ('Transferencia', 'troco_pix', 'fornecedor', None),
+            (11, 12, None), (2, 3, None), (21, None), (7, 8, None),
+            ('00000000000007', ''), (None, '5:1', '9:1,6:1', '9:1'))):
+        yield dict(base, id=bt_id, tipo=tipo, tipo_conciliacao=conc, account_id=account_id,
+                   destino_cliente_id=outra, origem_cliente_id=outra, conta_destino_id=dest_ba,
+                   fornecedor_id=forn, cnpj_cpf_digitos=cnpj, despesa_categorias=cats)
+
+
+def test_mesmas_contas_que_o_resolver_antigo():
+    res = Resolvedor(MAPAS)
+    linhas = list(_linhas())
+    # mapa antigo: 1ª conta configurada entre os lançamentos de cada transação
+    despesa = {}
+    for r in linhas:
+        for par in (r['despesa_categorias'] or '').split(','):
+            conta = MAPAS['categoria'].get(tuple(int(x) for x in par.split(':'))) if par else None
+            if conta and r['id'] not in despesa:
+                despesa[r['id']] = conta
+    for r in linhas:
+        assert res.contas(r, res.despesa(r['despesa_categorias'])) == _resolver_contas_contabeis(
+            r, despesa, MAPAS['coligada'], MAPAS['fornecedor'], MAPAS['cnpj'],
+            troco_pix_conta_map=MAPAS['troco_pix']), r
+
+
+class _Cursor:
+    """cache_versoes em memória; `sem_tabela` simula a migration não aplicada."""
+
+    def __init__(self, sem_tabela=False):
+        self.versoes = {}
+        self.sem_tabela = sem_tabela
+        self.row = None
+
+    def execute(self, sql, params=()):
+        if self.sem_tabela:
+            raise RuntimeError("Table 'cache_versoes' doesn't exist")
+        nome = params[0]
+        if sql.startswith('SELECT'):
+            self.row = {'versao': self.versoes[nome]} if nome in self.versoes else None
+        else:
+            self.versoes[nome] = self.versoes.get(nome, 0) + 1
+
+    def fetchone(self):
+        return self.row
+
+
+def test_cache_por_versao_e_invalidacao():
+    cur = _Cursor()
+    cargas = []
+
+    def carregar(c):
+        cargas.append(c)
+        return MAPAS
+
+    a = contas_contabeis.resolvedor(cur, carregar)
+    assert contas_contabeis.resolvedor(cur, carregar) is a and len(cargas) == 1
+
+    contas_contabeis.invalidar(cur)                   # gravação em outro worker: só a versão muda
+    contas_contabeis.resolvedor(cur, carregar)
+    assert cur.versoes == {'contas_contabeis': 1} and len(cargas) == 2
+    contas_contabeis.resolvedor(cur, carregar)
+    assert len(cargas) == 2
+
+    sem = _Cursor(sem_tabela=True)                    # sem a tabela: relê sempre, sem erro
+    contas_contabeis.invalidar(sem)
+    contas_contabeis.resolvedor(sem, carregar)
+    contas_contabeis.resolvedor(sem, carregar)
+    assert len(cargas) == 4
@@ -0,0 +1,98 @@
+import json
+
+from utils import dashboard_metricas as dm
+
+
+class _Tabela:
+    """dashboard_metricas em memória: só o SQL de ler/gravar/invalidar."""
+
+    def __init__(self, linhas=None):
+        self.linhas = linhas or {}   # bloco -> {'dados', 'sujo', 'versao', 'idade'}
+        self.commits = 0
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql, params=()):
+        self._sql, self._params = sql, params
+        if sql.startswith('INSERT INTO dashboard_metricas'):
+            _am, _emp, bloco, dados, versao_lida = params
+            atual = self.linhas.get(bloco)
+            self.linhas[bloco] = {
+                'dados': dados, 'idade': 0,
+                'versao': atual['versao'] if atual else 0,
+                'sujo': 1 if atual and atual['versao'] != versao_lida else 0,
+            }
+
+    def fetchall(self):
+        return [(b, ln['dados'], ln['sujo'], ln['versao'], ln['idade'])
+                for b, ln in self.linhas.items()]
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def _linha(dados, sujo=0, versao=0, idade=10):
+    return {'dados': json.dumps(dados), 'sujo': sujo, 'versao': versao, 'idade': idade}
+
+
+def test_recalcula_so_ausente_sujo_ou_vencido():
+    tabela = _Tabela({
+        'fretes': _linha({'fretes_mes': 3}),
+        'pedidos': _linha({'pedidos_mes': 1}, sujo=1, versao=2),
+        'onda1': _linha({'dia': {}}, idade=dm.BLOCOS['onda1']),
+    })
+    chamados = []
+
+    def calc(bloco, valor):
+        def f():
+            chamados.append(bloco)
+            return valor
+        return f
+
+    dados, recalculados = dm.obter(tabela, '2026-10', {
+        'fretes': calc('fretes', {'fretes_mes': 99}),
+        'pedidos': calc('pedidos', {'pedidos_mes': 5}),
+        'onda1': calc('onda1', {'dia': {'notas': 1}}),
+        'grafico': calc('grafico', {'fretes': [0] * 6}),
+    })
+
+    assert sorted(chamados) == sorted(recalculados) == ['grafico', 'onda1', 'pedidos']
+    assert dados['fretes'] == {'fretes_mes': 3}          # limpo: veio da tabela
+    assert dados['pedidos'] == {'pedidos_mes': 5}
+    assert tabela.linhas['pedidos']['sujo'] == 0
+    assert json.loads(tabela.linhas['grafico']['dados']) == {'fretes': [0] * 6}
+
+
+def test_invalidacao_durante_o_calculo_mantem_sujo():
+    tabela = _Tabela({'fretes': _linha({'fretes_mes': 1}, sujo=1, versao=4)})
+
+    def calcula_enquanto_alguem_grava():
+        tabela.linhas['fretes']['versao'] = 5   # invalidar() concorrente
+        return {'fretes_mes': 2}
+
+    dm.obter(tabela, '2026-10', {'fretes': calcula_enquanto_alguem_grava})
+    assert tabela.linhas['fretes']['sujo'] == 1
+
+
+def test_bloco_com_erro_nao_e_gravado():
+    tabela = _Tabela({'fretes': _linha({'fretes_mes': 7}, sujo=1)})
+
+    def quebra():
+        raise RuntimeError('Lost connection to MySQL server')
+
+    dados, recalculados = dm.obter(tabela, '2026-10', {'fretes': quebra, 'pedidos': quebra})
+    assert recalculados == []
+    assert dados == {'fretes': {'fretes_mes': 7}}           # valor anterior
+    assert tabela.linhas['fretes']['sujo'] == 1 and 'pedidos' not in tabela.linhas
+
+
+def test_frete_suja_o_lucro_dos_postos():
+    # fretes são as entradas do FIFO: mudou compra, mudou o lucro do mês aberto.
+    assert 'lucro_postos' in dm.BLOCOS_POR_TABELA['fretes']
@@ -0,0 +1,77 @@
+import pytest
+from flask import Flask
+
+import utils.db as db
+
+
+class _Conexao:
+    def __init__(self):
+        self.fechada = False
+        self.rollbacks = 0
+        self.commits = 0
+
+    def cursor(self, **kw):
+        return kw
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.fechada = True
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    abertas = []
+
+    def checkout():
+        abertas.append(_Conexao())
+        return abertas[-1], ('PoolError' if len(abertas) > 2 else None)
+
+    monkeypatch.setattr(db, '_checkout', checkout)
+    db.reset_pool_metrics()
+    app = Flask(__name__)
+    db.init_app(app)
+    return app, abertas
+
+
+def test_conexao_da_request_e_compartilhada(pool):
+    app, abertas = pool
+
+    @app.route('/r')
+    def rota():
+        externa = db.get_request_connection()
+        interna = db.get_request_connection()   # helper aninhado
+        assert interna.cursor(dictionary=True) == {'dictionary': True}
+        interna.close()
+        assert abertas[0].rollbacks == 0         # ainda há handle aberto
+        externa.commit()
+        externa.close()
+        assert abertas[0].rollbacks == 1 and not abertas[0].fechada
+        db.get_request_connection().close()
+        return 'ok'
+
+    assert app.test_client().get('/r').status_code == 200
+    assert len(abertas) == 1 and abertas[0].fechada
+
+    m = db.pool_metrics()
+    assert m['checkouts'] == 1 and m['shared_reuses'] == 2
+    assert m['in_use'] == 0 and m['hold_max_endpoint'] == 'rota'
+    assert m['top_endpoints'][0]['endpoint'] == 'rota'
+
+
+def test_metricas_de_fallback_e_posse(pool):
+    _app, abertas = pool
+    conns = [db.get_db_connection() for _ in range(3)]
+    m = db.pool_metrics()
+    assert m['in_use'] == 3 and m['in_use_peak'] == 3
+    assert m['fallbacks'] == 1 and m['fallback_reasons'] == {'PoolError': 1}
+    for c in conns:
+        c.close()
+        c.close()                                # idempotente
+    m = db.pool_metrics()
+    assert m['in_use'] == 0 and all(c.fechada for c in abertas)
+    assert m['top_endpoints'][0] == dict(m['top_endpoints'][0], endpoint='-', checkouts=3)
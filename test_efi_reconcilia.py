@@ -0,0 +1,110 @@
+import os
+import sys
+from datetime import date, datetime, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripts'))
+
+from fake_efi import FakeEfi  # noqa: E402
+from integrations import efi_reconcilia  # noqa: E402
+from utils import boletos  # noqa: E402
+
+CONFIG = {'EFI_CLIENT_ID': 'id', 'EFI_CLIENT_SECRET': 'segredo', 'EFI_SANDBOX': True}
+
+
+class _Banco:
+    """cobrancas (charge_id -> status) e efi_sincronizacao, só o SQL da rotina."""
+
+    def __init__(self, status, aberta_mais_antiga=None, ultima_varredura=None):
+        self.status = dict(status)
+        self.data_pagamento = {}
+        self.aberta_mais_antiga = aberta_mais_antiga
+        self.ultima_varredura = ultima_varredura
+        self.selects = 0
+
+    def cursor(self, dictionary=False):
+        self._dict = dictionary
+        return self
+
+    def execute(self, sql, params=()):
+        if 'WHERE charge_id IN' in sql:
+            self.selects += 1
+            self._linhas = [{'charge_id': c, 'status': self.status[c]}
+                            for c in params if c in self.status]
+        elif "SET status = 'pago'" in sql:
+            quando, cid = params
+            self.status[cid], self.data_pagamento[cid] = 'pago', quando
+        elif "SET status = 'cancelado'" in sql:
+            self.status[params[0]] = 'cancelado'
+        elif 'FROM efi_sincronizacao' in sql:
+            self._linhas = [(self.ultima_varredura,)] if self.ultima_varredura else []
+        elif 'MIN(data_emissao)' in sql:
+            self._linhas = [(self.aberta_mais_antiga,)]
+        else:
+            raise AssertionError(sql)
+
+    def fetchone(self):
+        return self._linhas[0] if self._linhas else None
+
+    def fetchall(self):
+        return self._linhas
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def efi(monkeypatch):
+    hoje = date.today().isoformat()
+    cobrancas = [{'id': 1000 + i, 'status': 'paid', 'created_at': hoje,
+                  'paid_at': '2026-10-0%d' % (1 + i % 9)} for i in range(230)]
+    cobrancas += [{'id': 2001, 'status': 'canceled', 'created_at': hoje},
+                  {'id': 2002, 'status': 'canceled', 'created_at': hoje},
+                  {'id': 2003, 'status': 'settled', 'created_at': hoje, 'paid_at': '2026-10-09'}]
+    fake = FakeEfi(cobrancas, atraso=0.02).iniciar()
+    monkeypatch.setenv('EFI_API_BASE', fake.url)
+    boletos._TOKEN_CACHE.clear()
+    yield fake
+    fake.parar()
+    boletos._TOKEN_CACHE.clear()
+
+
+def test_reconcilia_em_paralelo_com_um_select_por_lote(efi, monkeypatch):
+    status = {str(1000 + i): 'pendente' for i in range(230)}
+    status['1005'] = 'pago'
+    status.update({'2001': 'pendente', '2002': 'pago', '2003': 'pendente'})
+    banco = _Banco(status)
+    monkeypatch.setattr(efi_reconcilia, 'get_db_connection', lambda: banco)
+
+    resumo = efi_reconcilia.reconciliar(begin_date='2026-01-01', config=CONFIG, workers=4)
+
+    assert resumo['total_efi'] == 233
+    assert resumo['atualizados_pagos'] == 229 + 1            # 1005 já estava pago
+    assert resumo['atualizados_cancelados'] == 1             # 2002 pago por fora fica pago
+    assert banco.status['2002'] == 'pago' and banco.status['2001'] == 'cancelado'
+    assert banco.data_pagamento['1003'] == '2026-10-04'      # veio do detalhe
+    assert banco.selects == 1
+    # 3 páginas de paid + 1 de settled + 1 de canceled, em paralelo e na mesma conexão
+    listagens = [q for m, p, q in efi.requisicoes if p == '/v1/charges']
+    assert sorted((q['status'], q['page']) for q in listagens) == [
+        ('canceled', '1'), ('paid', '1'), ('paid', '2'), ('paid', '3'), ('settled', '1')]
+    assert efi.pico > 1
+    assert efi.conexoes <= 4 + 1                             # pool + authorize
+
+
+def test_janela_do_agendador(monkeypatch):
+    ontem = datetime.now() - timedelta(hours=1)
+    banco = _Banco({}, aberta_mais_antiga=None, ultima_varredura=ontem)
+    monkeypatch.setattr(efi_reconcilia, 'get_db_connection', lambda: banco)
+    assert efi_reconcilia.janela_agendador() is None         # nada em aberto
+
+    banco.aberta_mais_antiga = date.today() - timedelta(days=3)
+    assert efi_reconcilia.janela_agendador() == (banco.aberta_mais_antiga.isoformat(), False)
+
+    banco.ultima_varredura = datetime.now() - timedelta(hours=efi_reconcilia.VARREDURA_HORAS)
+    inicio, completa = efi_reconcilia.janela_agendador(dias_min=45)
+    assert completa and inicio == (date.today() - timedelta(days=45)).isoformat()
@@ -0,0 +1,161 @@
+import os
+import random
+import sys
+from datetime import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripts'))
+
+from fake_imap import FakeImap, gerar_mensagens, html_abertura, mensagem  # noqa: E402
+from integrations import els_email  # noqa: E402
+
+
+class _Banco:
+    """leitura_tanque_diaria, descargas_pendentes, produto e els_sincronizacao,
+    com transação (rollback desfaz o que não teve commit)."""
+
+    def __init__(self, falhar_titulo=None):
+        self.leituras = {}
+        self.descargas = {}
+        self.cursor_imap = {}
+        self.falhar_titulo = falhar_titulo
+        self.sql = []
+        self._pend = []
+        self._linhas = []
+
+    def cursor(self, dictionary=False):
+        return self
+
+    def _escrever(self, sql, params):
+        if 'INTO leitura_tanque_diaria' in sql:
+            if params[2] == self.falhar_titulo:
+                raise RuntimeError('Data too long for column titulo')
+            self._pend.append(('leituras', (params[0], params[1], params[3]), params))
+        elif 'INTO descargas_pendentes' in sql:
+            if params[-1] in self.descargas or any(k == params[-1] for _t, k, _p in self._pend):
+                raise RuntimeError('Duplicate entry for key uq_pend_chave')
+            self._pend.append(('descargas', params[-1], params))
+        elif 'INTO els_sincronizacao' in sql:
+            self._pend.append(('cursor_imap', params[0], params[1:]))
+        else:
+            raise AssertionError(sql)
+
+    def execute(self, sql, params=()):
+        self.sql.append(' '.join(sql.split())[:60])
+        if sql.lstrip().startswith('CREATE TABLE'):
+            self._linhas = []
+        elif 'FROM els_sincronizacao' in sql:
+            c = self.cursor_imap.get(params[0])
+            self._linhas = [{'uidvalidity': c[0], 'ultimo_uid': c[1]}] if c else []
+        elif 'FROM produto' in sql:
+            self._linhas = [{'id': 1, 'nome': 'GASOLINA COMUM'}, {'id': 2, 'nome': 'ETANOL'},
+                            {'id': 3, 'nome': 'DIESEL S-10'}, {'id': 4, 'nome': 'DIESEL S-500'}]
+        elif 'FROM descargas_pendentes WHERE chave IN' in sql:
+            self._linhas = [{'chave': c} for c in params if c in self.descargas]
+        elif 'FROM descargas_pendentes WHERE chave=' in sql:
+            self._linhas = [{'id': 1, 'status': 'pendente'}] if params[0] in self.descargas else []
+        else:
+            self._escrever(sql, params)
+
+    def executemany(self, sql, seq):
+        self.sql.append('MANY ' + ' '.join(sql.split())[:55])
+        for params in seq:
+            self._escrever(sql, params)
+
+    def fetchone(self):
+        return self._linhas[0] if self._linhas else None
+
+    def fetchall(self):
+        return self._linhas
+
+    def commit(self):
+        for tabela, chave, params in self._pend:
+            getattr(self, tabela)[chave] = params
+        self._pend = []
+
+    def rollback(self):
+        self._pend = []
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def imap(monkeypatch):
+    fake = FakeImap().iniciar()
+    for k, v in {'ELS_MAIL_IMAP_HOST': '127.0.0.1', 'ELS_MAIL_IMAP_PORT': str(fake.porta),
+                 'ELS_MAIL_IMAP_SSL': '0', 'ELS_MAIL_USER': 'posto@exemplo.com',
+                 'ELS_MAIL_PASSWORD': 'x', 'ELS_CLIENTE_ID': '7'}.items():
+        monkeypatch.setenv(k, v)
+    monkeypatch.setattr(els_email, 'LOTE_FETCH', 100)
+    yield fake
+    fake.parar()
+
+
+def _usar(monkeypatch, banco):
+    monkeypatch.setattr(els_email, 'get_db_connection', lambda: banco)
+    return banco
+
+
+def test_lotes_de_uid_e_cursor_incremental(imap, monkeypatch):
+    msgs = gerar_mensagens(250)
+    imap.adicionar(*msgs)
+    banco = _usar(monkeypatch, _Banco())
+
+    resumo = els_email.processar(dias=1)
+
+    assert imap.fetches() == ['101:200 (BODY.PEEK[])', '201:300 (BODY.PEEK[])',
+                              '301:350 (BODY.PEEK[])']
+    stores = [a for v, a in imap.comandos if v == 'UID STORE']
+    assert stores == ['101:350 +FLAGS \\Seen']
+    assert all(m['lida'] for m in imap.mensagens.values())
+    assert resumo['aberturas'] + resumo['descargas_pendentes'] + resumo['ignorados'] == 250
+    assert resumo['leituras'] == 4 * resumo['aberturas'] == len(banco.leituras)
+    assert resumo['descargas_pendentes'] == len(banco.descargas) > 0
+    assert {p[4] for p in banco.leituras.values()} == {1, 2, 3, 4}   # S10/S500 por slug
+    assert banco.sql.count('SELECT id, nome FROM produto') == 1
+    assert not any(s.startswith('INSERT INTO leitura') for s in banco.sql)   # só executemany
+    assert banco.cursor_imap['posto@exemplo.com/INBOX'] == (imap.uidvalidity, 350)
+
+    # Próxima rodada: só o que chegou depois do cursor, sem a janela SENTSINCE.
+    q = datetime.now().replace(microsecond=0)
+    imap.adicionar(mensagem(351, 'Fechamento de turno - ABERTURA',
+                            html_abertura(q, random.Random(1)), q))
+    resumo = els_email.processar(dias=1)
+    busca = [a for v, a in imap.comandos if v == 'UID SEARCH'][-1]
+    assert busca.startswith('(UID 351:* ') and 'SENTSINCE' not in busca
+    assert imap.fetches()[-1] == '351 (BODY.PEEK[])'
+    assert resumo['aberturas'] == 1
+    assert banco.cursor_imap['posto@exemplo.com/INBOX'] == (imap.uidvalidity, 351)
+
+
+def test_lote_que_falha_isola_a_mensagem_e_segura_o_cursor(imap, monkeypatch):
+    q = datetime.now().replace(microsecond=0)
+    rnd = random.Random(3)
+    msgs = [mensagem(100 + i, 'Fechamento de turno - ABERTURA',
+                     html_abertura(q.replace(minute=i), rnd), q) for i in range(1, 6)]
+    msgs[2] = mensagem(103, 'Fechamento de turno - ABERTURA',
+                       html_abertura(q.replace(minute=3), rnd).replace('tulo: ABERTURA',
+                                                                     'tulo: QUEBRA'), q)
+    imap.adicionar(*msgs)
+    banco = _usar(monkeypatch, _Banco(falhar_titulo='QUEBRA'))
+
+    resumo = els_email.processar(dias=1)
+
+    assert resumo['aberturas'] == 4 and len(banco.leituras) == 16
+    assert [u for u, m in sorted(imap.mensagens.items()) if not m['lida']] == [103]
+    assert banco.cursor_imap['posto@exemplo.com/INBOX'] == (imap.uidvalidity, 102)
+
+    banco.falhar_titulo = None               # corrigido: a próxima rodada pega a 103
+    resumo = els_email.processar(dias=1)
+    assert [a for v, a in imap.comandos if v == 'UID SEARCH'][-1].startswith('(UID 103:* ')
+    assert resumo['aberturas'] == 1 and len(banco.leituras) == 20
+    assert banco.cursor_imap['posto@exemplo.com/INBOX'] == (imap.uidvalidity, 105)
+
+
+def test_conjunto_de_uid_e_html():
+    assert els_email._conjunto(['107', '101', '103', '102', '110', '111']) == '101:103,107,110:111'
+    html = ('<!DOCTYPE html><html><!-- x --><p>Tanque: 1 - GASOLINA</p><br/>'
+            '<table><tr><td title="a>b">&Aacute;gua:</td><td>0 mm</td></tr></table></html>')
+    assert els_email._html_txt(html) == '\nTanque: 1 - GASOLINA\n\n\nÁgua:0 mm\n'
@@ -0,0 +1,129 @@
+import datetime as dt
+import io
+from decimal import Decimal
+
+import openpyxl
+
+import routes.bank_import as B
+from utils.contas_contabeis import Resolvedor
+
+D1, D2, D3 = dt.date(2026, 3, 1), dt.date(2026, 3, 2), dt.date(2026, 3, 3)
+
+CONTAS = Resolvedor({'coligada': {}, 'categoria': {}, 'fornecedor': {(1, 7): ('2.1.001', 'FORN 1')},
+                     'cnpj': {}, 'troco_pix': {}, 'cartao': {}})
+
+
+def _banco(bt_id, dia, **kw):
+    r = {'_kind': 'bank', 'id': bt_id, 'account_id': 70, 'data_transacao': dia, 'tipo': 'DEBIT',
+         'valor': Decimal('150.25'), 'descricao': f'PAGTO {bt_id}', 'tipo_conciliacao': 'fornecedor',
+         'fornecedor_id': 1, 'banco_cliente_id': 7, 'conta_apelido': 'SICREDI 70',
+         'conta_banco_codigo': '1.1.1', 'conta_banco_nome': 'BANCO X'}
+    r.update(kw)
+    return r
+
+
+def _cartao(kind, dia, valor):
+    campo_data, campo_valor = (('data_venda', 'total_venda') if kind == 'card'
+                               else ('data_recebimento', 'cycle_fee'))
+    return {'_kind': kind, campo_data: dia, campo_valor: valor, 'empresa_nome': 'POSTO',
+            'bandeira_nome': 'VISA', 'tipo_cartao': 'CREDITO',
+            'credito_cod': '4.1', 'credito_nome': 'RECEITA', 'debito_cod': '1.2', 'debito_nome': 'A RECEBER'}
+
+
+def _fontes():
+    banco = [_banco(1, D1), _banco(2, D2), _banco(3, D2), _banco(4, D3)]
+    vendas = [_cartao('card', D1, 900.5), _cartao('card', D2, 80.0)]
+    taxas = [_cartao('fee', D2, 12.34), _cartao('fee', D3, 1.5)]
+    return banco, vendas, taxas
+
+
+def test_merge_por_data_igual_ao_sort_estavel_e_csv_em_pedacos(monkeypatch):
+    banco, vendas, taxas = _fontes()
+    esperado = sorted(banco + vendas + taxas, key=B._contabil_data)   # sort estável antigo
+    regs = list(B._contabil_registros([iter(banco), iter(vendas), iter(taxas)], CONTAS))
+    assert [r[-1] for r in regs] == esperado
+
+    monkeypatch.setattr(B, '_CONTABIL_CSV_PEDACO', 100)
+    pedacos = list(B._contabil_csv(B._contabil_registros([iter(f) for f in _fontes()], CONTAS)))
+    assert len(pedacos) > 2                          # saiu aos poucos, não num bloco só
+    linhas = b''.join(pedacos).decode('utf-8').splitlines()
+    assert linhas[0] == '\ufeffDATA;DESCRIÇÃO;VALOR;Nº CONTA CRÉDITO;DESCRIÇÃO CONTA CRÉDITO;' \
+                        'Nº CONTA DÉBITO;DESCRIÇÃO CONTA DÉBITO'
+    assert linhas[1] == '01/03/2026;PAGTO 1;150,25;1.1.1;BANCO X;2.1.001;FORN 1'
+    assert linhas[2] == '01/03/2026;VENDA CARTÃO CREDITO – VISA (POSTO);900,5;4.1;RECEITA;1.2;A RECEBER'
+    assert [ln.split(';')[1] for ln in linhas[3:]] == [
+        'PAGTO 2', 'PAGTO 3', 'VENDA CARTÃO CREDITO – VISA (POSTO)',
+        'TAXA CARTÃO CREDITO – VISA (POSTO)', 'PAGTO 4', 'TAXA CARTÃO CREDITO – VISA (POSTO)']
+
+
+class _Cursor:
+    def __init__(self, linhas):
+        self.linhas = list(linhas)
+        self.lotes = []
+        self.fechado = False
+
+    def execute(self, sql, params=()):
+        self.sql = sql
+
+    def fetchmany(self, n):
+        lote, self.linhas = self.linhas[:n], self.linhas[n:]
+        self.lotes.append(len(lote))
+        return lote
+
+    def close(self):
+        self.fechado = True
+
+
+class _Conn:
+    def __init__(self, n):
+        self.cur = _Cursor({'id': i} for i in range(n))
+        self.consumido = False
+
+    def cursor(self, dictionary=False, buffered=None):
+        self.buffered = buffered
+        return self.cur
+
+    def consume_results(self):
+        self.consumido = True
+
+
+def test_cursor_sem_buffer_em_lotes_e_descarte_ao_cancelar(monkeypatch):
+    monkeypatch.setattr(B, '_CONTABIL_LOTE', 4)
+    conn = _Conn(10)
+    assert [r['id'] for r in B._ler_em_lotes(conn, 'SELECT', ())] == list(range(10))
+    assert conn.buffered is False and conn.cur.lotes == [4, 4, 2, 0]
+    assert conn.cur.fechado and not conn.consumido
+
+    conn = _Conn(10)                                  # download cancelado no meio
+    linhas = B._ler_em_lotes(conn, 'SELECT', ())
+    assert next(linhas) == {'id': 0}
+    linhas.close()
+    assert conn.consumido and conn.cur.fechado
+
+
+def test_xlsx_write_only_com_estilos_e_aba_de_avisos():
+    banco, vendas, taxas = _fontes()
+    sem_conta = dict(tipo_conciliacao='transferencia', conta_destino_banco_nome='CORA',
+                     conta_banco_codigo='', conta_banco_nome='')
+    banco[1].update(sem_conta)
+    banco[2].update(sem_conta)                        # mesma dupla de contas: um aviso só
+    buf = io.BytesIO()
+    B._contabil_xlsx(B._contabil_registros([iter(banco), iter(vendas), iter(taxas)], CONTAS), buf)
+
+    wb = openpyxl.load_workbook(io.BytesIO(buf.getvalue()))
+    ws = wb['Exportação Contábil']
+    assert ws.freeze_panes == 'A2' and ws.auto_filter.ref == 'A1:G1'
+    assert ws.column_dimensions['B'].width == 55
+    assert [c.value for c in ws[2]] == ['01/03/2026', 'PAGTO 1', 150.25, '1.1.1', 'BANCO X',
+                                        '2.1.001', 'FORN 1']
+    assert ws['C2'].number_format == '#,##0.00' and ws['A2'].fill.fill_type is None
+    assert ws['A3'].fill.fgColor.rgb == '00E8F5E9'                 # venda de cartão
+    assert ws['G4'].fill.fgColor.rgb == '00FFFF00'                 # transferência sem conta
+    assert ws.max_row == 9
+
+    avisos = [[c.value for c in linha] for linha in wb['⚠ Contas sem config'].iter_rows()]
+    assert avisos[1:] == [['SICREDI 70', 'CORA', 'Conta destino sem Conta Contábil configurada'],
+                          ['SICREDI 70', None, 'Conta bancária sem Conta Contábil configurada'],
+                          [None, None, None],
+                          [avisos[-1][0], None, None]]
+    assert avisos[-1][0].startswith('Para corrigir')
@@ -0,0 +1,83 @@
+import os
+import random
+import sys
+from datetime import date, timedelta
+from decimal import Decimal
+
+from utils.fifo import FilaFifo, avancar, calcular
+
+# o motor antigo (referência) vive no benchmark
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripts'))
+from bench_fifo import _avancar_lista, _calcular_lista  # noqa: E402
+
+
+def _movimentos(rnd, n_dias, decimal_do_banco):
+    """Compras/vendas sintéticas no formato das queries de fretes/vendas_posto."""
+    conv = (lambda v: Decimal(str(v))) if decimal_do_banco else (lambda v: v)
+    compras, vendas = [], []
+    d0 = date(2026, 1, 1)
+    for i in range(n_dias):
+        d = d0 + timedelta(days=i)
+        for _ in range(rnd.choice((0, 0, 1, 2))):
+            compras.append({
+                'data': d,
+                'qtde': conv(round(rnd.uniform(-5, 15000), rnd.choice((0, 3)))),
+                'custo': conv(round(rnd.uniform(0, 6.5), 4)),
+            })
+        if rnd.random() < 0.9:
+            qtde = round(rnd.uniform(-10, 9000), 3)
+            vendas.append({'data': d, 'qtde': conv(qtde),
+                           'valor_total': conv(round(qtde * rnd.uniform(5, 7), 2))})
+    rnd.shuffle(compras)  # a ordem de chegada não pode importar entre dias
+    return compras, vendas
+
+
+def _iniciais(rnd):
+    return [{'qtde': round(rnd.uniform(0, 20000), 3), 'custo': round(rnd.uniform(4, 6), 4)}
+            for _ in range(rnd.randint(0, 3))]
+
+
+def test_calcular_identico_ao_calculo_antigo():
+    for seed in range(200):
+        rnd = random.Random(seed)
+        exato = seed % 2 == 0
+        iniciais = _iniciais(rnd)
+        compras, vendas = _movimentos(rnd, rnd.randint(0, 60), decimal_do_banco=exato)
+
+        novo, camadas_novas = calcular(iniciais, compras, vendas, exato=exato)
+        antigo, camadas_antigas = _calcular_lista(iniciais, compras, vendas, exato=exato)
+
+        assert novo == antigo, seed
+        assert camadas_novas == camadas_antigas, seed
+
+
+def test_avancar_identico_ao_avanco_antigo():
+    for seed in range(200):
+        rnd = random.Random(seed)
+        iniciais = _iniciais(rnd)
+        compras, vendas = _movimentos(rnd, rnd.randint(0, 90), decimal_do_banco=True)
+        vendas_por_data = {}
+        for v in vendas:
+            vendas_por_data[v['data']] = float(v['qtde'])
+
+        fila = FilaFifo(iniciais)
+        avancar(fila, compras, vendas_por_data)
+        antigas = [{'qtde': float(c['qtde']), 'custo': float(c['custo'])}
+                   for c in iniciais if float(c['qtde']) > 0]
+        _avancar_lista(antigas, compras, vendas_por_data)
+
+        assert fila.camadas() == antigas, seed
+
+
+def test_serie_diaria_fecha_com_o_total():
+    compras = [{'data': date(2026, 3, 1), 'qtde': 1000, 'custo': 5},
+               {'data': date(2026, 3, 2), 'qtde': 500, 'custo': 6}]
+    vendas = [{'data': date(2026, 3, 1), 'qtde': 800, 'valor_total': 5600},
+              {'data': date(2026, 3, 3), 'qtde': 400, 'valor_total': 2800}]
+
+    res, camadas = calcular([{'qtde': 100, 'custo': 4}], compras, vendas, serie=True)
+
+    assert [d['cogs'] for d in res['dias']] == [3900.0, 0.0, 2100.0]
+    assert res['cogs'] == 6000.0
+    assert res['dias'][-1]['estoque_qtde'] == res['estoque_final_qtde'] == 400.0
+    assert camadas == [{'qtde': Decimal('400'), 'custo': Decimal('6')}]
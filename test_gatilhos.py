@@ -0,0 +1,30 @@
+from utils.gatilhos import sincronizar_gatilhos
+
+_DDL = ("CREATE TRIGGER `g_ins` AFTER INSERT ON `t` FOR EACH ROW "
+        "INSERT INTO log (x) VALUES (NEW.x)")
+
+
+class _Cur:
+    def __init__(self, existentes):
+        self.existentes, self.sqls = existentes, []
+
+    def execute(self, sql, params=()):
+        self.sqls.append(' '.join(sql.split()))
+
+    def fetchall(self):
+        return self.existentes
+
+
+def test_gatilho_igual_nao_e_refeito():
+    cur = _Cur([('g_ins', 'AFTER', 'INSERT', 't', 'INSERT INTO log (x)\n   VALUES (NEW.x)')])
+    assert sincronizar_gatilhos(cur, [_DDL]) == []
+    assert len(cur.sqls) == 1            # só a leitura do information_schema
+
+
+def test_gatilho_ausente_ou_diferente_e_refeito():
+    cur = _Cur([('g_ins', 'AFTER', 'INSERT', 't', 'INSERT INTO log (x) VALUES (OLD.x)')])
+    assert sincronizar_gatilhos(cur, [_DDL]) == ['g_ins']
+    assert cur.sqls[1:] == ['DROP TRIGGER IF EXISTS `g_ins`', _DDL]
+
+    cur = _Cur([])
+    assert sincronizar_gatilhos(cur, [_DDL]) == ['g_ins']
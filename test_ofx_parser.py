@@ -0,0 +1,50 @@
+import io
+
+from integrations.ofx_parser import OFXParser, iter_transactions
+
+_SGML = (
+    "OFXHEADER:100\r\nDATA:OFXSGML\r\n\r\n"
+    "<OFX>\r\n<BANKMSGSRSV1><STMTTRNRS><STMTRS><BANKTRANLIST>\r\n"
+    "<DTSTART>20260101\r\n"
+    "<STMTTRN>\r\n<TRNTYPE>DEBIT\r\n<DTPOSTED>20260105120000[-3:BRT]\r\n"
+    "<TRNAMT>-150,25\r\n<FITID>0001\r\n<NAME>PIX ENVIADO POSTO 12.345.678/0001-95\r\n"
+    "<MEMO>COMBUSTIVEL\r\n"
+    "<STMTTRN>\r\n<TRNTYPE>CREDIT\r\n<DTPOSTED>20260106\r\n"
+    "<TRNAMT>980.00\r\n<FITID>0002\r\n<MEMO>DEP DINHEIRO\r\n"
+    "</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>\r\n"
+)
+
+_XML = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n<OFX><BANKMSGSRSV1><STMTTRNRS>'
+    '<STMTRS><BANKTRANLIST>'
+    + ''.join(
+        f'<STMTTRN><TRNTYPE>OTHER</TRNTYPE><DTPOSTED>202602{d:02d}</DTPOSTED>'
+        f'<TRNAMT>{-d * 10.5:.2f}</TRNAMT><FITID>X{d}</FITID>'
+        f'<NAME>TED {d}</NAME><MEMO>CPF 123.456.789-0{d % 10}</MEMO></STMTTRN>\n'
+        for d in range(1, 29)
+    )
+    + '<STMTTRN><TRNTYPE>DEBIT</TRNTYPE><DTPOSTED>lixo</DTPOSTED>'
+      '<TRNAMT>1</TRNAMT></STMTTRN>'
+    + '</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>'
+)
+
+
+def test_streaming_igual_ao_parser_em_memoria_sgml_sem_fechamento():
+    esperado = OFXParser(_SGML).get_transactions()
+    assert len(esperado) == 2
+    for chunk in (1, 7, 64, 1 << 16):
+        assert list(iter_transactions(_SGML, chunk_size=chunk)) == esperado
+
+
+def test_streaming_igual_ao_parser_em_memoria_xml():
+    esperado = OFXParser(_XML).get_transactions()
+    assert len(esperado) == 28
+    assert list(iter_transactions(_XML, chunk_size=13)) == esperado
+
+
+def test_streaming_le_arquivo_binario_e_iteravel_de_bytes():
+    dados = _SGML.replace('POSTO', 'POSTO SÃO JOÃO').encode('latin-1')
+    esperado = OFXParser(dados.decode('latin-1')).get_transactions()
+    assert list(iter_transactions(io.BytesIO(dados), chunk_size=5)) == esperado
+    pedacos = [dados[i:i + 3] for i in range(0, len(dados), 3)]
+    assert list(iter_transactions(pedacos)) == esperado
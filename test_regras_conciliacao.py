@@ -0,0 +1,284 @@
+import os
+import random
+import sys
+
+from utils.regras_conciliacao import IndiceRegras, indice_para
+
+# o laço antigo (referência) vive no benchmark
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripts'))
+from bench_regras_conciliacao import _primeira_regra_linear  # noqa: E402
+
+
+def _regra(rid, padrao, padrao2=None, tipo_match='contem', tipo='AMBOS', conta=None):
+    return {
+        'id': rid, 'padrao_descricao': padrao, 'padrao_secundario': padrao2,
+        'tipo_match': tipo_match, 'tipo_transacao': tipo, 'account_id': conta,
+    }
+
+
+def test_composta_antes_da_simples_como_no_order_by():
+    regras = [
+        _regra(7, 'DEP', 'DINHEIRO'),
+        _regra(3, 'DEP'),
+    ]
+    indice = IndiceRegras(regras)
+
+    assert indice.primeira('DEP DINHEIRO AG 123', 'CREDIT', 1) == 0
+    assert indice.primeira('DEP CHEQUE AG 123', 'CREDIT', 1) == 1
+    assert indice.primeira('PIX RECEBIDO', 'CREDIT', 1) is None
+
+
+def test_filtra_conta_tipo_e_match_exato():
+    regras = [
+        _regra(1, 'TARIFA', conta=5),
+        _regra(2, 'tarifa pacote', tipo_match='exato', tipo='DEBIT'),
+        _regra(3, 'TARIFA', tipo='CREDIT'),
+    ]
+    indice = IndiceRegras(regras)
+
+    assert indice.primeira('Tarifa Pacote', 'DEBIT', 5) == 0
+    assert indice.primeira('Tarifa Pacote', 'DEBIT', 9) == 1
+    assert indice.primeira('Tarifa Pacote X', 'DEBIT', 9) is None
+    assert indice.primeira('TARIFA PACOTE', 'CREDIT', 9) == 2
+
+
+def test_tipo_transacao_nulo_nunca_casa_como_no_laco_antigo():
+    regras = [_regra(1, 'PIX', tipo=None)]
+    assert IndiceRegras(regras).primeira('PIX', 'CREDIT', 1) is None
+    assert _primeira_regra_linear(regras, 'PIX', 'CREDIT', 1) is None
+
+
+def test_equivalente_ao_laco_antigo_em_dados_aleatorios():
+    rnd = random.Random(20260301)
+    vocab = ['PIX', 'TED', 'DEP', 'DINHEIRO', 'TARIFA', 'BOLETO', 'SHELL',
+             'POSTO', 'LIQ', 'COBRANCA', 'IPIRANGA', 'A', 'AA', 'TAR', '']
+    regras = []
+    for rid in range(1, 301):
+        regras.append(_regra(
+            rid,
+            ' '.join(rnd.sample(vocab, rnd.randint(1, 2))).strip().lower(),
+            rnd.choice([None, '', rnd.choice(vocab)]),
+            rnd.choice(['contem', 'contem', 'exato']),
+            rnd.choice(['AMBOS', 'CREDIT', 'DEBIT', None]),
+            rnd.choice([None, None, 0, 1, 2]),
+        ))
+    for _ in range(3000):
+        desc = ' '.join(rnd.choice(vocab) for _ in range(rnd.randint(0, 4)))
+        tipo = rnd.choice(['CREDIT', 'DEBIT'])
+        conta = rnd.choice([1, 2, 3])
+        assert indice_para(regras).primeira(desc, tipo, conta) == \
+            _primeira_regra_linear(regras, desc, tipo, conta), desc
+
+
+def test_indice_recompila_quando_regra_muda():
+    regras = [_regra(1, 'PIX')]
+    primeiro = indice_para(regras)
+    assert indice_para([dict(r) for r in regras]) is primeiro
+
+    regras[0]['padrao_descricao'] = 'TED'
+    novo = indice_para(regras)
+    assert novo is not primeiro
+    assert novo.primeira('TED 123', 'DEBIT', 1) == 0
+
+
+# ---------------------------------------------------------------------------
+# Modo incremental e reavaliação de regra editada
+# ---------------------------------------------------------------------------
+
+def _sql_aceita(where, params, tx):
+    """Avalia as cláusulas de `_filtro_da_regra` como o MySQL (ci, NULL falso)."""
+    params = list(params)
+    desc = tx['descricao']
+    for clausula in where:
+        if clausula.startswith('(status='):
+            ok = tx['status'] == 'pendente'
+        elif clausula == 'descricao = %s':
+            ok = desc is not None and desc.upper() == params.pop(0).upper()
+        elif clausula == "(descricao = '' OR descricao IS NULL)":
+            ok = not desc
+        elif clausula == 'descricao LIKE %s':
+            trecho = params.pop(0)[1:-1].replace('\\%', '%').replace('\\_', '_')
+            trecho = trecho.replace('\\\\', '\\')
+            ok = desc is not None and trecho.upper() in desc.upper()
+        elif clausula == 'tipo = %s':
+            ok = tx['tipo'] == params.pop(0)
+        elif clausula == 'account_id = %s':
+            ok = tx['account_id'] == params.pop(0)
+        else:
+            raise AssertionError(clausula)
+        if not ok:
+            return False
+    return True
+
+
+def test_filtro_sql_da_regra_e_superconjunto_do_matcher():
+    from routes.conciliacao_regras import _filtro_da_regra
+
+    rnd = random.Random(20260402)
+    vocab = ['PIX', 'TED', ' TED', 'TARIFA ', '50%', 'A_B', '', ' ', 'pix ted']
+    for _ in range(400):
+        regra = _regra(
+            1, rnd.choice(vocab), rnd.choice([None, '', ' ', rnd.choice(vocab)]),
+            rnd.choice(['contem', 'exato']),
+            rnd.choice(['AMBOS', 'CREDIT', 'DEBIT', None]),
+            rnd.choice([None, 0, 1, 2]),
+        )
+        filtro = _filtro_da_regra(regra)
+        indice = IndiceRegras([regra])
+        for _ in range(40):
+            tx = {
+                'descricao': rnd.choice([None, ''] + [
+                    ''.join(rnd.sample(vocab, rnd.randint(1, 3)))
+                    for _ in range(4)
+                ]),
+                'tipo': rnd.choice(['CREDIT', 'DEBIT']),
+                'account_id': rnd.choice([1, 2]),
+                'status': 'pendente',
+            }
+            if indice.primeira(tx['descricao'], tx['tipo'], tx['account_id']) is None:
+                continue
+            assert filtro is not None, regra
+            assert _sql_aceita(*filtro, tx), (regra, tx)
+
+
+class _CursorRegras:
+    """Só o SQL de `_auto_conciliar_por_regras`: regras, pendentes e escritas."""
+
+    def __init__(self, regras, transacoes):
+        self.regras = regras
+        self.transacoes = transacoes
+        self.escritas = []
+        self._linhas = []
+
+    def execute(self, sql, params=()):
+        if 'FROM bank_conciliacao_regras' in sql:
+            self._linhas = list(self.regras)
+            return
+        assert 'FROM bank_transactions bt' in sql
+        linhas = list(self.transacoes)
+        if ' IN (' in sql:
+            ids = set(params[-sql.count('%s', sql.index(' IN (')):])
+            linhas = [t for t in linhas if t['id'] in ids]
+        self._linhas = linhas
+
+    def fetchall(self):
+        return self._linhas
+
+    def executemany(self, sql, linhas):
+        self.escritas.append((sql, list(linhas)))
+
+
+class _Conn:
+    def commit(self):
+        pass
+
+
+def test_tx_ids_limita_as_escritas_a_esses_ids():
+    from routes.bank_import import _auto_conciliar_por_regras
+
+    regras = [dict(_regra(1, 'PIX'), ativo=1, forma_recebimento_id=9,
+                   fornecedor_id=None, titulo_id=None, categoria_id=None,
+                   subcategoria_id=None)]
+    transacoes = [
+        {'id': i, 'descricao': 'PIX RECEBIDO', 'tipo': 'CREDIT', 'cnpj_cpf': None,
+         'data_transacao': None, 'valor': 10, 'account_id': 1,
+         'conta_cliente_id': None}
+        for i in range(1, 7)
+    ]
+    cursor = _CursorRegras(regras, transacoes)
+
+    assert _auto_conciliar_por_regras(cursor, _Conn(), tx_ids=[2, 5]) == 2
+    sql, linhas = cursor.escritas[0]
+    assert 'UPDATE bank_transactions' in sql
+    assert sorted(linha[-1] for linha in linhas) == [2, 5]
+
+    cursor.escritas.clear()
+    assert _auto_conciliar_por_regras(cursor, _Conn(), tx_ids=[]) == 0
+    assert cursor.escritas == []
+
+
+def test_fila_de_reavaliacao_nao_duplica_regra_pendente(monkeypatch):
+    import threading
+
+    import routes.conciliacao_regras as cr
+
+    liberar = threading.Event()
+    rodadas = []
+
+    def _reavaliar(regra_id, refazer=()):
+        rodadas.append(regra_id)
+        if regra_id == 1:
+            liberar.wait(5)
+
+    monkeypatch.setattr(cr, '_reavaliar_regra', _reavaliar)
+    cr.agendar_reavaliacao(1)
+    while not rodadas:
+        liberar.wait(0.01)
+    # a thread está presa na regra 1: a 2 entra uma vez só
+    cr.agendar_reavaliacao(2)
+    cr.agendar_reavaliacao(2)
+    liberar.set()
+    cr._reavaliar_fila.join()
+
+    assert rodadas == [1, 2]
+
+
+def test_refazer_junta_os_ids_de_agendamentos_pendentes(monkeypatch):
+    import threading
+
+    import routes.conciliacao_regras as cr
+
+    liberar = threading.Event()
+    rodadas = []
+
+    def _reavaliar(regra_id, refazer=()):
+        rodadas.append((regra_id, sorted(refazer)))
+        if regra_id == 1:
+            liberar.wait(5)
+
+    monkeypatch.setattr(cr, '_reavaliar_regra', _reavaliar)
+    cr.agendar_reavaliacao(1)
+    while not rodadas:
+        liberar.wait(0.01)
+    cr.agendar_reavaliacao(2, [10, 11])
+    cr.agendar_reavaliacao(2, [11, 12])
+    liberar.set()
+    cr._reavaliar_fila.join()
+
+    assert rodadas == [(1, []), (2, [10, 11, 12])]
+
+
+class _CursorConciliadas:
+    def __init__(self, linhas):
+        self.linhas = linhas
+        self.sql = None
+        self.params = None
+
+    def execute(self, sql, params=()):
+        self.sql, self.params = sql, list(params)
+
+    def fetchall(self):
+        return self.linhas
+
+
+def test_conciliadas_pela_regra_confere_destino_e_matcher():
+    from routes.conciliacao_regras import _ids_conciliados_pela_regra
+
+    regra = dict(_regra(1, 'PIX', tipo='CREDIT'), forma_recebimento_id=9,
+                 fornecedor_id=None, titulo_id=None, categoria_id=None)
+    cursor = _CursorConciliadas([
+        {'id': 1, 'descricao': 'PIX RECEBIDO', 'tipo': 'CREDIT', 'account_id': 1},
+        # LIKE ignora acento; o matcher não: não foi esta regra
+        {'id': 2, 'descricao': 'PÍX RECEBIDO', 'tipo': 'CREDIT', 'account_id': 1},
+    ])
+    assert _ids_conciliados_pela_regra(cursor, regra) == [1]
+    assert "conciliado_por='auto-regra'" in cursor.sql
+    assert 'forma_recebimento_id <=> %s AND fornecedor_id <=> %s' in cursor.sql
+    assert cursor.params[-2:] == [9, None]
+
+    despesa = dict(regra, tipo_transacao='AMBOS', titulo_id=3, categoria_id=4)
+    _ids_conciliados_pela_regra(cursor, despesa)
+    assert 'lancamentos_despesas' in cursor.sql
+    assert cursor.params[-4:] == [3, 4, 9, None]
+
+    assert _ids_conciliados_pela_regra(cursor, dict(regra, tipo_transacao=None)) == []
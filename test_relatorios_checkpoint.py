@@ -0,0 +1,52 @@
+from datetime import date
+
+from routes.relatorios import _gravar_checkpoints_fifo
+
+
+class _Banco:
+    """fifo_checkpoint_versao/diario em memória: só o SQL da gravação."""
+
+    def __init__(self, versoes):
+        self.versoes = dict(versoes)      # (cliente, produto) -> versao
+        self.gravados = []
+        self.commits = self.rollbacks = 0
+
+    def execute(self, sql, params=()):
+        if sql.strip().startswith('INSERT IGNORE INTO fifo_checkpoint_versao'):
+            self.versoes.setdefault(tuple(params), 0)
+        elif 'FOR UPDATE' in sql:
+            self._linha = {'versao': self.versoes[tuple(params)]}
+        else:
+            raise AssertionError(sql)
+
+    def fetchone(self):
+        return self._linha
+
+    def executemany(self, sql, linhas):
+        assert 'INSERT INTO fifo_checkpoint_diario' in sql
+        self.gravados.extend(linhas)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+def test_checkpoint_so_grava_se_a_versao_nao_mudou():
+    banco = _Banco({(1, 10): 3, (1, 11): 5})
+    camadas = {date(2026, 2, 1): [[100.0, 5.0]]}
+    pendentes = {
+        (1, 10): {'versao': 3, 'camadas': dict(camadas)},
+        # um frete entrou depois da leitura da versão: o replay pode não tê-lo
+        (1, 11): {'versao': 4, 'camadas': dict(camadas)},
+        # nunca houve movimento: a linha da versão nasce com 0
+        (2, 10): {'versao': 0, 'camadas': dict(camadas)},
+        (2, 11): {'versao': 0, 'camadas': {}},
+    }
+
+    _gravar_checkpoints_fifo(banco, banco, pendentes)
+
+    assert sorted((c, p) for c, p, _d, _j in banco.gravados) == [(1, 10), (2, 10)]
+    assert banco.gravados[0][3] == '[[100.0, 5.0]]'
+    assert (banco.commits, banco.rollbacks) == (2, 1)
@@ -0,0 +1,131 @@
+from collections import defaultdict
+from datetime import date
+
+from utils import saldo_tempo_real
+from utils.saldo_tempo_real import SaldoTempoReal
+
+HOJE = date(2026, 10, 18)
+PRODUTOS = (1, 2, 4, 5)
+
+
+class _Banco:
+    """As três tabelas do saldo, já filtradas para HOJE: só linhas com id."""
+
+    def __init__(self):
+        self.aberturas = []   # (id, cliente_id, pid, litros, tanque)
+        self.descargas = []   # (id, cliente_id, pid, litros)
+        self.vendas = []      # (id, cliente_id, pid, litros)
+        self.consultas = []
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql, params=()):
+        self.consultas.append(sql)
+        self._params = params
+        if 'MAX(id)' in sql:
+            self._um = {
+                'venda': max((v[0] for v in self.vendas), default=0),
+                'descarga': max((d[0] for d in self.descargas), default=0),
+                'leitura': max((a[0] for a in self.aberturas), default=0),
+            }
+        elif 'FROM leitura_tanque_diaria' in sql:
+            somas, tanques = defaultdict(float), defaultdict(list)
+            for _id, cid, pid, litros, tanque in self.aberturas:
+                somas[(cid, pid)] += litros
+                tanques[(cid, pid)].append(str(tanque))
+            self._todas = [{'cliente_id': c, 'pid': p, 'litros': v,
+                            'tanques': ','.join(tanques[(c, p)])}
+                           for (c, p), v in somas.items()]
+        else:
+            fonte = self.descargas if 'FROM descargas_pendentes' in sql else self.vendas
+            _ini, _fim, de, ate = params
+            somas = defaultdict(float)
+            for id_, cid, pid, litros in fonte:
+                if de < id_ <= ate:
+                    somas[(cid, pid)] += litros
+            self._todas = [{'cliente_id': c, 'pid': p, 'litros': v}
+                           for (c, p), v in somas.items()]
+
+    def fetchone(self):
+        return self._um
+
+    def fetchall(self):
+        return self._todas
+
+
+def _por_chave(saldo, cliente_id=None, desde=0):
+    versao, linhas = saldo.cards(cliente_id, desde)
+    return versao, {(c['cliente_id'], c['pid']): c for c in linhas}
+
+
+def _forca_ciclo(saldo):
+    saldo._atualizado_em -= saldo_tempo_real.CICLO_SEG
+
+
+def test_semente_e_incremento_so_com_linhas_novas():
+    banco = _Banco()
+    banco.aberturas = [(1, 1, 2, 5000.0, 1), (2, 1, 2, 3000.0, 2)]
+    banco.descargas = [(1, 1, 2, 1000.0)]
+    banco.vendas = [(1, 1, 2, 200.0), (2, 1, 1, 50.0)]
+    saldo = SaldoTempoReal()
+
+    saldo.atualizar(banco, HOJE, PRODUTOS)
+    v1, linhas = _por_chave(saldo)
+    assert linhas[(1, 2)]['saldo'] == 5000 + 3000 + 1000 - 200
+    assert linhas[(1, 2)]['tanques'] == '1,2'
+    assert linhas[(1, 1)]['saldo'] is None          # sem abertura hoje
+    assert linhas[(1, 1)]['ven'] == 50
+
+    # Sem ciclo vencido e sem aviso: não toca no banco.
+    n = len(banco.consultas)
+    saldo.atualizar(banco, HOJE, PRODUTOS)
+    assert len(banco.consultas) == n
+
+    banco.vendas.append((3, 1, 2, 30.0))
+    saldo.notificar()
+    saldo.atualizar(banco, HOJE, PRODUTOS)
+    novas = banco.consultas[n:]
+    assert not any('leitura_tanque_diaria l' in q for q in novas)   # abertura não mudou
+    assert not any('FROM descargas_pendentes d' in q for q in novas)
+    v2, mudou = _por_chave(saldo, desde=v1)
+    assert v2 > v1 and list(mudou) == [(1, 2)]      # só o card que mudou
+    assert mudou[(1, 2)]['ven'] == 230
+
+
+def test_outro_worker_aparece_no_ciclo_sem_aviso():
+    banco = _Banco()
+    saldo = SaldoTempoReal()
+    saldo.atualizar(banco, HOJE, PRODUTOS)
+    assert saldo.cards()[1] == []
+
+    banco.descargas.append((7, 3, 5, 15000.0))
+    banco.aberturas.append((9, 3, 5, 2000.0, 4))
+    _forca_ciclo(saldo)
+    saldo.atualizar(banco, HOJE, PRODUTOS)
+    _v, linhas = _por_chave(saldo, cliente_id=3)
+    assert linhas[(3, 5)]['saldo'] == 17000
+
+
+def test_cancelamento_pede_semente_e_dia_novo_zera():
+    banco = _Banco()
+    banco.aberturas = [(1, 1, 4, 1000.0, 3)]
+    banco.vendas = [(1, 1, 4, 100.0), (2, 1, 4, 40.0)]
+    saldo = SaldoTempoReal()
+    saldo.atualizar(banco, HOJE, PRODUTOS)
+
+    del banco.vendas[1]                               # nota cancelada
+    saldo.notificar(semear=True)
+    saldo.atualizar(banco, HOJE, PRODUTOS)
+    assert _por_chave(saldo)[1][(1, 4)]['saldo'] == 900
+
+    banco.aberturas, banco.vendas = [], []
+    saldo.atualizar(banco, date(2026, 10, 19), PRODUTOS)
+    assert saldo.cards()[1] == []
+
+
+def test_esperar_acorda_com_aviso():
+    saldo = SaldoTempoReal()
+    saldo.notificar()
+    saldo.esperar(saldo.versao, timeout=5)   # retorna já: há aviso pendente
+    assert saldo._pendente == 'incremento'
@@ -0,0 +1,102 @@
+from utils import schema_registry as sr
+
+
+class _Banco:
+    """schema_garantias em memória."""
+
+    def __init__(self, gravadas=None):
+        self.gravadas = dict(gravadas or {})   # nome -> versao
+        self.consultas = []
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql, params=()):
+        self.consultas.append(sql)
+        if sql.startswith('INSERT INTO schema_garantias'):
+            nome, versao = params
+            self.gravadas[nome] = versao
+
+    def fetchall(self):
+        return list(self.gravadas.items())
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def _registro_limpo(monkeypatch):
+    monkeypatch.setattr(sr, '_REGISTRO', {})
+    monkeypatch.setattr(sr, '_verificado', False)
+
+
+def test_roda_uma_vez_e_nao_memoriza_falha(monkeypatch):
+    _registro_limpo(monkeypatch)
+    chamadas = []
+    respostas = [False, None]
+
+    @sr.garantia
+    def _ensure_x(conn):
+        chamadas.append(conn)
+        return respostas.pop(0)
+
+    assert _ensure_x('c1') is False      # falhou: não fica memorizada
+    assert _ensure_x('c2') is True
+    assert _ensure_x('c3') is True       # já vale: nem chama
+    assert chamadas == ['c1', 'c2']
+
+
+def test_partida_pula_versao_gravada_e_grava_as_novas(monkeypatch):
+    _registro_limpo(monkeypatch)
+    rodou = []
+
+    @sr.garantia
+    def _ensure_velha(conn):
+        rodou.append('velha')
+
+    @sr.garantia(versao=2)
+    def _ensure_mudou(conn):
+        rodou.append(('mudou', conn))
+
+    @sr.garantia
+    def _ensure_sem_conn(conn=None):
+        rodou.append(('sem_conn', conn))
+
+    @sr.garantia(persistir=False)
+    def _reparo():
+        rodou.append('reparo')
+
+    nome = '%s.%%s' % __name__
+    banco = _Banco({nome % '_ensure_velha': 1, nome % '_ensure_mudou': 1,
+                    nome % '_reparo': 1})
+    resumo = sr.garantir_todas(banco)
+
+    assert rodou == [('mudou', banco), ('sem_conn', None), 'reparo']
+    assert resumo['puladas'] == 1 and resumo['rodadas'] == 3 and not resumo['falhas']
+    assert banco.gravadas[nome % '_ensure_mudou'] == 2
+    assert nome % '_ensure_sem_conn' in banco.gravadas
+    assert sr.schema_verificado()
+
+    # Na request: tudo pronto, nenhum acesso ao banco.
+    assert _ensure_velha(None) and _ensure_mudou(None) and _reparo()
+    assert len(rodou) == 3
+
+
+def test_falha_na_partida_fica_para_a_request(monkeypatch):
+    _registro_limpo(monkeypatch)
+
+    @sr.garantia
+    def _ensure_quebra():
+        raise RuntimeError('sem permissão de ALTER')
+
+    banco = _Banco()
+    resumo = sr.garantir_todas(banco)
+    assert resumo['falhas'] == ['%s._ensure_quebra' % __name__]
+    assert not sr.schema_verificado()
+    assert sr.pendentes() == ['%s._ensure_quebra' % __name__]
+    assert banco.gravadas == {}
@@ -0,0 +1,208 @@
+import json
+
+import pytest
+from flask import Flask
+
+import routes.vendas_api as api
+
+TOKEN = 'tok-teste'
+CNPJ = '12345678000195'
+
+
+class _Banco:
+    """vendas_xml/vendas_xml_itens em memória, com o SQL que a rota usa."""
+
+    def __init__(self, depara=None, falhar_executemany=False):
+        self.vendas = {}          # chave -> {'id', 'situacao'}
+        self.itens = []           # (venda_id, n_item, produto_id)
+        self.depara = depara or {}
+        self.falhar_executemany = falhar_executemany
+        self.round_trips = 0
+        self._pendente = None
+
+    def cursor(self):
+        return _Cursor(self)
+
+    def commit(self):
+        self._pendente = None
+
+    def rollback(self):
+        if self._pendente:
+            vendas, itens = self._pendente
+            self.vendas, self.itens = vendas, itens
+        self._pendente = None
+
+    def close(self):
+        pass
+
+    def _snapshot(self):
+        if self._pendente is None:
+            self._pendente = (dict(self.vendas), list(self.itens))
+
+
+class _Cursor:
+    def __init__(self, db):
+        self.db = db
+        self._rows = []
+        self.lastrowid = None
+        self.rowcount = 0
+
+    def _insere_venda(self, p):
+        if p[0] == 'QUEBRA':
+            raise ValueError('Data too long for column chave')
+        self.db._snapshot()
+        vid = len(self.db.vendas) + 1
+        self.db.vendas[p[0]] = {'id': vid, 'situacao': 'ativa'}
+        self.lastrowid = vid
+
+    def _insere_item(self, p):
+        self.db._snapshot()
+        self.db.itens.append((p[0], p[1], p[4]))
+
+    def execute(self, sql, params=()):
+        self.db.round_trips += 1
+        self._rows = []
+        if sql.startswith('SELECT id FROM vendas_xml WHERE chave = %s'):
+            v = self.db.vendas.get(params[0])
+            self._rows = [(v['id'],)] if v else []
+        elif sql.startswith('SELECT chave FROM vendas_xml WHERE chave IN'):
+            self._rows = [(c,) for c in params if c in self.db.vendas]
+        elif sql.startswith('SELECT chave, id FROM vendas_xml WHERE chave IN'):
+            self._rows = [(c, self.db.vendas[c]['id']) for c in params if c in self.db.vendas]
+        elif sql.startswith('INSERT INTO vendas_xml ('):
+            self._insere_venda(params)
+        elif sql.startswith('INSERT INTO vendas_xml_itens'):
+            self._insere_item(params)
+        elif 'FROM vendas_xml_depara_produto' in sql:
+            self._rows = [(c, p, pid) for (c, p), pid in self.db.depara.items() if c in params]
+        elif 'FROM clientes' in sql or 'FROM cliente_produtos' in sql:
+            self._rows = []
+        elif sql.startswith('UPDATE vendas_xml SET situacao'):
+            v = self.db.vendas.get(params[0])
+            self.rowcount = 1 if v else 0
+            if v:
+                v['situacao'] = 'cancelada'
+        elif 'FROM vendas_xml_itens' in sql:
+            # aplicar_depara_venda (caminho nota a nota): nada a resolver.
+            self._rows = []
+        else:
+            raise AssertionError(sql)
+
+    def executemany(self, sql, seq):
+        self.db.round_trips += 1
+        if self.db.falhar_executemany:
+            raise RuntimeError('Deadlock found when trying to get lock')
+        for p in seq:
+            if sql.startswith('INSERT INTO vendas_xml ('):
+                self._insere_venda(p)
+            else:
+                self._insere_item(p)
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def close(self):
+        pass
+
+
+def _nota(n, itens=2, **extra):
+    return dict({
+        'chave': f'CH{n:04d}', 'modelo': 65, 'serie': 1, 'numero': n,
+        'dh_emissao': '2026-10-01 10:00:00', 'cnpj_emitente': CNPJ,
+        'valor_total': 100,
+        'itens': [{'n_item': i + 1, 'cprod': 'GC', 'cod_anp': '320102001',
+                   'quantidade': 10, 'valor_total': 50} for i in range(itens)],
+    }, **extra)
+
+
+@pytest.fixture
+def cliente(monkeypatch):
+    monkeypatch.setenv('ROBO_VENDAS_TOKEN', TOKEN)
+    app = Flask(__name__)
+    app.register_blueprint(api.vendas_api_bp)
+
+    def usar(db, lote=500):
+        monkeypatch.setattr(api, 'get_db_connection', lambda: db)
+        monkeypatch.setattr(api, '_LOTE', lote)
+        return app.test_client()
+
+    return usar
+
+
+def _post(client, **kw):
+    kw.setdefault('headers', {})['Authorization'] = f'Bearer {TOKEN}'
+    resp = client.post('/api/vendas', **kw)
+    return resp.status_code, resp.get_json()
+
+
+def test_lote_json(cliente):
+    db = _Banco(depara={(CNPJ, 'GC'): 7})
+    db.vendas['CH0003'] = {'id': 999, 'situacao': 'ativa'}
+    client = cliente(db, lote=4)
+    notas = [_nota(n) for n in range(10)] + [_nota(1), 'lixo', {'modelo': 65}]
+    status, r = _post(client, json={'notas': notas, 'cancelamentos': ['CH0000', 'NAOEXISTE']})
+
+    assert status == 200
+    assert r['ok'] == [f'CH{n:04d}' for n in range(10) if n != 3]
+    assert r['repetidas'] == ['CH0003', 'CH0001']
+    assert r['canceladas'] == ['CH0000']
+    assert {e['erro'] for e in r['erros']} == {
+        'nota não é objeto JSON', 'chave ausente', 'cancelamento: chave não encontrada'}
+    assert r['novas_gravadas'] == 9
+    assert r['throughput']['notas'] == 13 and r['throughput']['itens'] == 18
+    assert r['throughput']['lotes'] == 3
+    # produto_id vindo do de-para carregado uma vez por lote.
+    assert {pid for _v, _n, pid in db.itens} == {7}
+    # 4 idas por lote (existe, cabeçalhos, ids, itens) + de-para, bem menos que 1 por linha.
+    assert db.round_trips < 30
+
+
+def test_ndjson_streaming(cliente):
+    db = _Banco()
+    client = cliente(db, lote=3)
+    linhas = [json.dumps(_nota(n, itens=1)) for n in range(5)]
+    linhas[2] = json.dumps(_nota(2, itens=1) | {'itens': [{'n_item': 1, 'produto_id': 4}]})
+    corpo = '\n'.join(linhas + ['', '{quebrado', json.dumps({'cancelamento': 'CH0004'})]) + '\n'
+    status, r = _post(client, data=corpo.encode(),
+                      content_type='application/x-ndjson')
+
+    assert status == 200
+    assert r['ok'] == [f'CH{n:04d}' for n in range(5)]
+    assert r['canceladas'] == ['CH0004']
+    assert r['erros'] == [{'chave': None, 'erro': 'linha 7: JSON inválido'}]
+    assert db.vendas['CH0004']['situacao'] == 'cancelada'
+    assert (db.vendas['CH0002']['id'], 1, 4) in db.itens
+
+
+def test_lote_que_falha_regrava_nota_a_nota(cliente):
+    db = _Banco(falhar_executemany=True)
+    client = cliente(db, lote=10)
+    notas = [_nota(0), _nota(1, chave='QUEBRA'), _nota(2, itens=0)]
+    status, r = _post(client, json={'notas': notas})
+
+    assert status == 200
+    assert r['ok'] == ['CH0000', 'CH0002']
+    assert r['erros'] == [{'chave': 'QUEBRA', 'erro': 'Data too long for column chave'}]
+    assert set(db.vendas) == {'CH0000', 'CH0002'}
+
+
+def test_chave_que_nao_e_texto_vira_erro_da_nota(cliente):
+    db = _Banco()
+    client = cliente(db, lote=10)
+    notas = [_nota(0), _nota(1, chave=['CH0001']), _nota(2, chave={'x': 1}),
+             _nota(3, chave=True), _nota(4, chave='  CH0004 ')]
+    status, r = _post(client, json={'notas': notas})
+
+    assert status == 200
+    assert r['ok'] == ['CH0000', 'CH0004']
+    assert r['erros'] == [{'chave': None, 'erro': 'chave inválida (esperado texto)'}] * 3
+    assert set(db.vendas) == {'CH0000', 'CH0004'}
+
+
+def test_sem_token(cliente):
+    client = cliente(_Banco())
+    resp = client.post('/api/vendas', json={'notas': []})
+    assert resp.status_code == 401
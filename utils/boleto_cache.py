@@ -0,0 +1,223 @@
+"""
+utils/boleto_cache.py
+=====================
+
+Cache em disco dos PDFs de boleto, para visualizar_boleto / download_boleto
+não irem à EFI a cada clique.
+
+O mesmo boleto é aberto e compartilhado (link do WhatsApp) várias vezes, e
+cada acesso com `pdf_boleto` em URL fazia fetch_boleto_pdf_stream -- até dois
+GETs no provedor, 30s de timeout cada -- e jogava os bytes fora. Aqui o
+primeiro fetch grava o arquivo e os seguintes saem do disco.
+
+Layout: BOLETO_CACHE_DIR/<charge_id>/<sha256>.pdf. O nome é o hash do
+conteúdo, então o ETag é de graça (If-None-Match -> 304 no navegador) e um
+PDF novo da mesma cobrança (vencimento prorrogado) ganha outro nome: grava
+o novo, apaga o velho.
+
+Tamanho limitado por BOLETO_CACHE_MAX_MB (default 256). LRU pelo mtime:
+cada acerto dá um utime() no arquivo e, quando um arquivo novo passa do
+limite, os menos usados saem até sobrar 90%. Como o estado é só o disco,
+vários workers gunicorn dividem o mesmo cache sem combinar nada.
+
+Só entra no cache o que começa com %PDF: página de erro com status 200 do
+provedor não vira "boleto".
+"""
+import hashlib
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+from utils.boletos import BOLETOS_DIR, fetch_boleto_pdf_stream
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.getenv("BOLETO_CACHE_DIR") or os.path.join(BOLETOS_DIR, "cache")
+MAX_BYTES = int(float(os.getenv("BOLETO_CACHE_MAX_MB", "256")) * 1024 * 1024)
+
+Entrada = namedtuple("Entrada", "caminho etag tamanho")
+
+# Locks listrados: cobranças diferentes podem dividir um lock (só serializa
+# dois fetches), e o conjunto não cresce com o número de cobranças.
+_LOCKS = tuple(threading.Lock() for _ in range(64))
+_disponivel = None      # (ok, quando): disco gravável? revisto a cada minuto
+
+
+def _pasta(charge_id):
+    cid = re.sub(r"[^0-9A-Za-z_-]", "", str(charge_id or ""))
+    return os.path.join(CACHE_DIR, cid) if cid else None
+
+
+def _lock(charge_id):
+    """Um fetch por cobrança por vez neste processo (prefetch x visualização)."""
+    return _LOCKS[hash(str(charge_id)) % len(_LOCKS)]
+
+
+def disponivel():
+    """CACHE_DIR existe e é gravável. Sem disco, as rotas fazem o proxy antigo."""
+    global _disponivel
+    agora = time.monotonic()
+    if _disponivel is None or (not _disponivel[0] and agora - _disponivel[1] > 60):
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            ok = os.access(CACHE_DIR, os.W_OK)
+        except OSError:
+            ok = False
+        if not ok:
+            logger.warning("boleto_cache: %s indisponível; PDFs vão direto do provedor", CACHE_DIR)
+        _disponivel = (ok, agora)
+    return _disponivel[0]
+
+
+def obter(charge_id):
+    """Entrada do cache (e marca o uso para o LRU), ou None."""
+    pasta = _pasta(charge_id)
+    if not pasta:
+        return None
+    try:
+        nomes = [n for n in os.listdir(pasta) if n.endswith(".pdf")]
+    except OSError:
+        return None
+    for nome in nomes:
+        caminho = os.path.join(pasta, nome)
+        try:
+            os.utime(caminho)
+            return Entrada(caminho, nome[:-4][:32], os.path.getsize(caminho))
+        except OSError:
+            continue            # outro worker despejou no meio do caminho
+    return None
+
+
+def guardar(charge_id, pedacos):
+    """Grava o PDF (iterável de bytes) no cache. Devolve a Entrada, ou None
+    se o conteúdo não for PDF ou o disco falhar."""
+    pasta = _pasta(charge_id)
+    if not pasta:
+        return None
+    tmp = None
+    try:
+        os.makedirs(pasta, exist_ok=True)
+        h = hashlib.sha256()
+        inicio = b""
+        fd, tmp = tempfile.mkstemp(dir=pasta, suffix=".tmp")
+        with os.fdopen(fd, "wb") as fh:
+            for pedaco in pedacos:
+                if not pedaco:
+                    continue
+                if len(inicio) < 5:
+                    inicio += pedaco[:5 - len(inicio)]
+                h.update(pedaco)
+                fh.write(pedaco)
+        if not inicio.startswith(b"%PDF"):
+            logger.warning("boleto_cache: conteúdo de %s não é PDF; não guardado", charge_id)
+            return None
+        digest = h.hexdigest()
+        final = os.path.join(pasta, digest + ".pdf")
+        os.replace(tmp, final)
+        tmp = None
+        for nome in os.listdir(pasta):           # versões antigas da cobrança
+            if nome.endswith(".pdf") and nome != digest + ".pdf":
+                try:
+                    os.remove(os.path.join(pasta, nome))
+                except OSError:
+                    pass
+        entrada = Entrada(final, digest[:32], os.path.getsize(final))
+    except OSError:
+        logger.exception("boleto_cache: falha gravando PDF de %s", charge_id)
+        return None
+    finally:
+        if tmp:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+    despejar()
+    return entrada
+
+
+def buscar(credentials, charge_id, origem):
+    """Do cache; se faltar, de `origem` (URL do provedor ou arquivo local),
+    guardando. None quando não deu para obter um PDF (ou sem disco)."""
+    entrada = obter(charge_id)
+    if entrada or not origem or not _pasta(charge_id) or not disponivel():
+        return entrada
+    with _lock(charge_id):
+        entrada = obter(charge_id)               # outra thread acabou de buscar
+        if entrada:
+            return entrada
+        if origem.startswith(("http://", "https://")):
+            resp = fetch_boleto_pdf_stream(credentials, origem)
+            if resp is None or getattr(resp, "status_code", None) != 200:
+                return None
+            try:
+                return guardar(charge_id, resp.iter_content(chunk_size=65536))
+            finally:
+                resp.close()
+        if os.path.isfile(origem):
+            with open(origem, "rb") as fh:
+                return guardar(charge_id, iter(lambda: fh.read(65536), b""))
+    return None
+
+
+def prefetch(credentials, charge_id, origem):
+    """buscar() numa thread: a emissão não espera o PDF para responder."""
+    if not charge_id or not origem:
+        return None
+    t = threading.Thread(target=_prefetch, args=(credentials, charge_id, origem),
+                         name="boleto-prefetch", daemon=True)
+    t.start()
+    return t
+
+
+def _prefetch(credentials, charge_id, origem):
+    try:
+        buscar(credentials, charge_id, origem)
+    except Exception:
+        logger.exception("boleto_cache: prefetch de %s falhou", charge_id)
+
+
+def invalidar(charge_id):
+    """Tira a cobrança do cache (vencimento alterado = PDF novo)."""
+    pasta = _pasta(charge_id)
+    if pasta:
+        shutil.rmtree(pasta, ignore_errors=True)
+
+
+def despejar(limite=None):
+    """Remove os PDFs menos usados até o cache caber em 90% do limite."""
+    limite = MAX_BYTES if limite is None else limite
+    arquivos, total = [], 0
+    try:
+        pastas = list(os.scandir(CACHE_DIR))
+    except OSError:
+        return 0
+    for p in pastas:
+        if not p.is_dir():
+            continue
+        try:
+            for a in os.scandir(p.path):
+                if a.name.endswith(".pdf"):
+                    st = a.stat()
+                    arquivos.append((st.st_mtime, st.st_size, a.path))
+                    total += st.st_size
+        except OSError:
+            continue
+    if total <= limite:
+        return 0
+    removidos = 0
+    for _mtime, tamanho, caminho in sorted(arquivos):
+        if total <= limite * 0.9:
+            break
+        try:
+            os.remove(caminho)
+            total -= tamanho
+            removidos += 1
+            os.rmdir(os.path.dirname(caminho))   # só sai se ficou vazia
+        except OSError:
+            pass
+    return removidos
@@ -23,7 +23,6 @@ import ast
 from datetime import datetime, timedelta
 
 import requests
-from efipay import EfiPay
 from utils.db import get_db_connection
 
 logger = logging.getLogger(__name__)
@@ -36,6 +35,13 @@ DEBUG_PAYLOAD = os.getenv("EFI_DEBUG_PAYLOAD", "false").lower() in ("1", "true",
 BOLETOS_DIR = os.getenv("BOLETOS_DIR", "/tmp/boletos")
 
 
+def _efi_sdk(credentials):
+    """Instancia o SDK da EFI. Import aqui dentro: o efipay pesa no boot de
+    todo worker e só é usado quando um boleto é emitido/consultado."""
+    from efipay import EfiPay
+    return EfiPay(credentials)
+
+
 def _sanitize_for_log(obj):
     """Cópia do objeto com campos sensíveis mascarados para logs."""
     try:
@@ -390,7 +396,9 @@ def _get_bearer_token(credentials):
                 logger.debug("_get_bearer_token: token em cache")
             return entry.get("access_token")
 
-        base = "https://cobrancas-h.api.efipay.com.br" if sandbox else "https://cobrancas.api.efipay.com.br"
+        # EFI_API_BASE: servidor alternativo (scripts/fake_efi.py nos testes offline).
+        base = os.getenv("EFI_API_BASE") or (
+            "https://cobrancas-h.api.efipay.com.br" if sandbox else "https://cobrancas.api.efipay.com.br")
         url = f"{base}/v1/authorize"
 
         client_secret = credentials.get("client_secret")
@@ -505,7 +513,7 @@ def fetch_charge(credentials, charge_id):
         
         # Tentar primeiro via SDK (pode ter certificado configurado)
         try:
-            efi = EfiPay({
+            efi = _efi_sdk({
                 "client_id": credentials.get("client_id"),
                 "client_secret": credentials.get("client_secret"),
                 "sandbox": credentials.get("sandbox", True),
@@ -820,7 +828,7 @@ def cancel_charge(credentials, charge_id):
 
         # 0) tentativa via SDK (se disponível) — alguns SDKs expõem método de cancelamento
         try:
-            efi = EfiPay({
+            efi = _efi_sdk({
                 "client_id": credentials.get("client_id"),
                 "client_secret": credentials.get("client_secret"),
                 "sandbox": credentials.get("sandbox", True),
@@ -1487,7 +1495,7 @@ def emitir_boleto_frete(frete_id, vencimento_str=None):
 
         efi = None
         try:
-            efi = EfiPay(credentials)
+            efi = _efi_sdk(credentials)
             try:
                 getattr(efi, "create_charge")
             except Exception:
@@ -0,0 +1,64 @@
+"""
+CNPJ só com dígitos nas consultas: coluna gerada quando existe, REPLACE quando não.
+
+O cadastro guarda o CNPJ com máscara (12.345.678/0001-90) e o XML / o extrato
+trazem só dígitos. As colunas geradas STORED (clientes.cnpj_digitos,
+fornecedores.cnpj_digitos, bank_transactions.cnpj_cpf_digitos) guardam o valor
+já limpo e indexado, mas nem todo banco as tem:
+  - clientes e fornecedores: migrations/20261019_cnpj_digitos_guardado.sql;
+  - bank_transactions: só pelo scripts/backfill_cnpj_digitos.py --aplicar. O
+    ADD de coluna STORED reconstrói a tabela inteira (ALGORITHM=COPY, escrita
+    bloqueada enquanto copia), o que não cabe na partida do app.
+
+Por isso nenhuma consulta cita a coluna direto: digitos() devolve a coluna se
+verificar_colunas() a encontrou no information_schema neste processo, e a
+normalização antiga linha a linha (correta, só mais lenta) até lá. Coluna
+criada com o app no ar passa a ser usada na próxima partida.
+"""
+from utils.schema_registry import garantia
+
+# (tabela, coluna de origem) -> coluna gerada
+_GERADAS = {
+    ('clientes', 'cnpj'): 'cnpj_digitos',
+    ('fornecedores', 'cnpj'): 'cnpj_digitos',
+    ('bank_transactions', 'cnpj_cpf'): 'cnpj_cpf_digitos',
+}
+
+_existentes = set()     # (tabela, coluna gerada) vistas no information_schema
+
+
+def limpo(expr):
+    """A normalização antiga: tira ponto, barra, hífen e espaço de `expr`."""
+    return "REPLACE(REPLACE(REPLACE(REPLACE(%s,'.',''),'/',''),'-',''),' ','')" % expr
+
+
+@garantia(persistir=False)
+def verificar_colunas(conn):
+    """Anota quais colunas geradas existem. Roda uma vez por processo na partida
+    (utils.schema_registry.garantir_todas); não cria nada."""
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            "SELECT TABLE_NAME, COLUMN_NAME FROM information_schema.COLUMNS"
+            " WHERE TABLE_SCHEMA = DATABASE()"
+            " AND TABLE_NAME IN ('clientes', 'fornecedores', 'bank_transactions')"
+            " AND COLUMN_NAME IN ('cnpj_digitos', 'cnpj_cpf_digitos')"
+        )
+        achadas = {(t, c) for t, c in cur.fetchall()}
+    finally:
+        cur.close()
+    _existentes.clear()
+    _existentes.update(
+        (tabela, gerada) for (tabela, _origem), gerada in _GERADAS.items()
+        if (tabela, gerada) in achadas
+    )
+    return True
+
+
+def digitos(tabela, alias=None, origem='cnpj'):
+    """Expressão SQL do CNPJ sem máscara de `tabela` (com `alias.` se dado)."""
+    prefixo = '%s.' % alias if alias else ''
+    gerada = _GERADAS[(tabela, origem)]
+    if (tabela, gerada) in _existentes:
+        return prefixo + gerada
+    return limpo(prefixo + origem)
@@ -0,0 +1,176 @@
+"""
+utils/contas_contabeis.py
+=========================
+
+Configuração de contas contábeis da exportação contábil
+(bank_import.exportar_contabil), guardada por worker, e a resolução
+débito/crédito de cada transação montada sobre ela.
+
+Antes, cada exportação relia seis mapas do banco (coligadas, despesas,
+fornecedores, CNPJ, troco PIX, cartões) -- o de despesas varrendo
+lancamentos_despesas inteiro -- e `_resolver_contas_contabeis` recriava a
+closure `_lookup_coligada` a cada linha, percorrendo o mapa de coligadas
+todo atrás da empresa. A configuração quase nunca muda.
+
+Versão: a linha 'contas_contabeis' de cache_versoes. As rotas que gravam
+essa configuração (plano de contas, coligadas das contas bancárias, contas
+dos cartões, do troco PIX, das categorias de despesa, dos fornecedores)
+chamam `invalidar(cursor)` antes do commit, então a versão sobe na mesma
+transação. A exportação lê só a versão (uma linha pela PK): igual à do
+cache, usa o `Resolvedor` guardado; diferente, recarrega. Como a versão
+está no banco, a gravação feita por um worker vale para os outros. Sem a
+tabela (migration não aplicada) recarrega a cada exportação, como antes.
+
+`Resolvedor` é a tabela pré-calculada: coligadas por (conta, empresa) e por
+empresa, contas de despesa por (categoria, empresa), fornecedor e CNPJ por
+empresa -- cada ramo da regra vira um ou dois lookups em dict. A regra é a
+de `_resolver_contas_contabeis`, que continua em bank_import como
+referência (test_contas_contabeis compara as duas).
+"""
+
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+NOME = 'contas_contabeis'
+
+_cache_lock = threading.Lock()
+_cache = {'versao': None, 'resolvedor': None}
+
+
+class Resolvedor:
+    """Contas de débito/crédito das transações a partir dos mapas de
+    `_contabil_mapas` (chaves coligada, categoria, fornecedor, cnpj,
+    troco_pix, cartao)."""
+
+    def __init__(self, mapas):
+        self.mapas = mapas
+        self._coligada = mapas['coligada']
+        self._categoria = mapas['categoria']
+        self._fornecedor = mapas['fornecedor']
+        self._cnpj = mapas['cnpj']
+        self._troco_pix = mapas['troco_pix']
+        # Conta enviadora desconhecida: a 1ª config da empresa, na ordem do mapa
+        self._coligada_da_empresa = {}
+        for (_ba_id, cliente_id), cfg in self._coligada.items():
+            self._coligada_da_empresa.setdefault(cliente_id, cfg)
+
+    def despesa(self, categorias):
+        """Conta da despesa vinculada à transação.
+
+        `categorias` = 'categoria:empresa,...' dos lançamentos de despesa da
+        transação (coluna despesa_categorias); vale o 1º par configurado.
+        """
+        if not categorias:
+            return None
+        for par in categorias.split(','):
+            categoria_id, _, cliente_id = par.partition(':')
+            try:
+                conta = self._categoria.get((int(categoria_id), int(cliente_id)))
+            except ValueError:
+                continue
+            if conta:
+                return conta
+        return None
+
+    def _coligada_cfg(self, account_id, cliente_id):
+        # Com account_id conhecido, só a entrada exata da conta enviadora
+        if not cliente_id:
+            return None
+        if account_id:
+            return self._coligada.get((account_id, cliente_id))
+        return self._coligada_da_empresa.get(cliente_id)
+
+    def contas(self, row, despesa=None):
+        """(debito_cod, debito_nome, credito_cod, credito_nome) da transação;
+        `despesa` = `self.despesa(row['despesa_categorias'])`."""
+        banco = (row.get('conta_banco_codigo') or '', row.get('conta_banco_nome') or '')
+        tipo_conc = (row.get('tipo_conciliacao') or '').lower()
+        banco_cliente_id = row.get('banco_cliente_id')
+
+        if row.get('tipo', '') == 'DEBIT':
+            credito = banco
+            if 'transferen' in tipo_conc:
+                cfg = self._coligada_cfg(row.get('account_id'), row.get('destino_cliente_id'))
+                debito = cfg['debito'] if cfg else ('', '')
+                if not debito[0]:
+                    # Recíproca: config da conta destino para a empresa enviadora
+                    dest_ba_id = row.get('conta_destino_id')
+                    if dest_ba_id and banco_cliente_id:
+                        cfg = self._coligada.get((dest_ba_id, banco_cliente_id))
+                        if cfg:
+                            debito = cfg['credito']
+                if not debito[0]:
+                    debito = (row.get('conta_destino_codigo') or '', row.get('conta_destino_nome') or '')
+            elif despesa:
+                debito = despesa
+            elif 'troco_pix' in tipo_conc and banco_cliente_id:
+                debito = self._troco_pix.get(banco_cliente_id) or ('', '')
+            else:
+                debito = ('', '')
+                fornecedor_id = row.get('fornecedor_id')
+                if fornecedor_id and banco_cliente_id:
+                    debito = self._fornecedor.get((fornecedor_id, banco_cliente_id)) or debito
+                if not debito[0]:
+                    cnpj = row.get('cnpj_cpf_digitos')
+                    if cnpj and banco_cliente_id:
+                        debito = self._cnpj.get((cnpj, banco_cliente_id)) or debito
+        else:
+            debito = banco
+            if 'transferen' in tipo_conc:
+                cfg = self._coligada_cfg(row.get('account_id'), row.get('origem_cliente_id'))
+                credito = cfg['credito'] if cfg else ('', '')
+                if not credito[0]:
+                    credito = (row.get('conta_origem_codigo') or '', row.get('conta_origem_nome') or '')
+            else:
+                credito = (row.get('conta_fr_codigo') or '', row.get('conta_fr_nome') or '')
+
+        return debito[0] or '', debito[1] or '', credito[0] or '', credito[1] or ''
+
+
+def versao(cursor):
+    """Versão atual da configuração (0 se nunca gravada); None sem a tabela."""
+    try:
+        cursor.execute("SELECT versao FROM cache_versoes WHERE nome = %s", (NOME,))
+        row = cursor.fetchone()
+    except Exception:
+        logger.warning("contas_contabeis: cache_versoes indisponível; mapas relidos.", exc_info=True)
+        return None
+    if not row:
+        return 0
+    return int(row['versao'] if isinstance(row, dict) else row[0])
+
+
+def resolvedor(cursor, carregar):
+    """Resolvedor da versão atual: o do cache ou `carregar(cursor)` -> mapas."""
+    v = versao(cursor)
+    with _cache_lock:
+        if v is not None and _cache['versao'] == v:
+            return _cache['resolvedor']
+    r = Resolvedor(carregar(cursor))
+    if v is not None:
+        with _cache_lock:
+            _cache['versao'], _cache['resolvedor'] = v, r
+    return r
+
+
+def limpar():
+    """Esquece o resolvedor deste worker."""
+    with _cache_lock:
+        _cache['versao'], _cache['resolvedor'] = None, None
+
+
+def invalidar(cursor):
+    """Nova versão da configuração -- chamar antes do commit de quem grava.
+
+    Falha aqui (tabela ausente) não derruba a gravação: só fica registrada.
+    """
+    limpar()
+    try:
+        cursor.execute(
+            "INSERT INTO cache_versoes (nome, versao, atualizado_em) VALUES (%s, 1, NOW())"
+            " ON DUPLICATE KEY UPDATE versao = versao + 1, atualizado_em = NOW()",
+            (NOME,))
+    except Exception:
+        logger.warning("contas_contabeis: não incrementou cache_versoes.", exc_info=True)
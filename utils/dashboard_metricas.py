@@ -0,0 +1,185 @@
+"""
+Blocos de KPI da home (bases.index) materializados em `dashboard_metricas`.
+
+Cada bloco (cadastros, fretes, pedidos, grafico, vendas_posto, lucro_postos,
+onda1) é um dict JSON guardado por (ano_mes, empresa_id, bloco); empresa_id 0
+é a visão consolidada que a home mostra. A home lê TODOS os blocos do mês numa
+única consulta pela PK e só recalcula na hora o bloco que estiver ausente,
+sujo ou vencido (TTL).
+
+Quem deixa um bloco sujo:
+  - as rotas que gravam fretes, pedidos, vendas_posto e o fechamento/reabertura
+    do FIFO chamam invalidar('<tabela>') depois do commit;
+  - o TTL cobre o que não tem gancho (cadastros de clientes/motoristas, a
+    Onda 1 que muda a cada envio do robô de vendas).
+
+O agendador (integrations/dashboard_scheduler) chama atualizar() de tempos em
+tempos para recalcular os blocos sujos/vencidos fora da request, de modo que
+normalmente a home só lê.
+
+Corrida invalidação x recálculo: invalidar() incrementa `versao`; o recálculo
+grava com sujo = (versao mudou desde a leitura), então uma alteração feita no
+meio do cálculo não é apagada pelo resultado antigo.
+"""
+import json
+import logging
+import os
+from datetime import date, datetime
+from decimal import Decimal
+
+logger = logging.getLogger(__name__)
+
+EMPRESA_TODAS = 0
+
+TTL_PADRAO = int(os.environ.get('DASHBOARD_TTL_SEG', 15 * 60))
+TTL_ONDA1 = int(os.environ.get('DASHBOARD_ONDA1_TTL_SEG', 2 * 60))
+
+# Bloco -> TTL em segundos.
+BLOCOS = {
+    'cadastros': TTL_PADRAO,
+    'fretes': TTL_PADRAO,
+    'pedidos': TTL_PADRAO,
+    'grafico': TTL_PADRAO,
+    'vendas_posto': TTL_PADRAO,
+    'lucro_postos': TTL_PADRAO,
+    'onda1': TTL_ONDA1,
+}
+
+# Tabela alterada -> blocos que dependem dela. O lucro do mês aberto sai do
+# FIFO, e as compras (entradas do FIFO) são os fretes.
+BLOCOS_POR_TABELA = {
+    'fretes': ('cadastros', 'fretes', 'grafico', 'lucro_postos'),
+    'pedidos': ('cadastros', 'pedidos', 'grafico'),
+    'vendas_posto': ('vendas_posto', 'lucro_postos'),
+    'fifo': ('lucro_postos',),
+}
+
+_SQL_LER = (
+    "SELECT bloco, dados, sujo, versao, "
+    "TIMESTAMPDIFF(SECOND, atualizado_em, NOW()) AS idade "
+    "FROM dashboard_metricas WHERE ano_mes = %s AND empresa_id = %s"
+)
+
+_SQL_GRAVAR = (
+    "INSERT INTO dashboard_metricas "
+    "(ano_mes, empresa_id, bloco, dados, sujo, versao, atualizado_em) "
+    "VALUES (%s, %s, %s, %s, 0, 0, NOW()) "
+    "ON DUPLICATE KEY UPDATE dados = VALUES(dados), atualizado_em = NOW(), "
+    "sujo = IF(versao = %s, 0, 1)"
+)
+
+
+def _json_default(v):
+    if isinstance(v, Decimal):
+        return float(v)
+    if isinstance(v, (date, datetime)):
+        return v.isoformat()
+    raise TypeError(f'{type(v).__name__} não serializável')
+
+
+def _precisa_recalcular(linha):
+    if linha is None or linha['sujo']:
+        return True
+    idade = linha['idade']
+    return idade is None or idade >= BLOCOS.get(linha['bloco'], TTL_PADRAO)
+
+
+def ler(cur, ano_mes, empresa_id=EMPRESA_TODAS):
+    """{bloco: {'bloco', 'dados', 'sujo', 'versao', 'idade'}} do mês (uma consulta)."""
+    cur.execute(_SQL_LER, (ano_mes, empresa_id))
+    linhas = {}
+    for row in cur.fetchall():
+        if not isinstance(row, dict):
+            row = dict(zip(('bloco', 'dados', 'sujo', 'versao', 'idade'), row))
+        row['dados'] = json.loads(row['dados'])
+        linhas[row['bloco']] = row
+    return linhas
+
+
+def gravar(cur, ano_mes, bloco, dados, versao_lida=0, empresa_id=EMPRESA_TODAS):
+    cur.execute(_SQL_GRAVAR, (
+        ano_mes, empresa_id, bloco,
+        json.dumps(dados, default=_json_default, ensure_ascii=False),
+        versao_lida,
+    ))
+
+
+def obter(conn, ano_mes, calculos, empresa_id=EMPRESA_TODAS, forcar=False):
+    """
+    Dados de todos os blocos de `calculos` ({bloco: fn() -> dict}) para o mês.
+
+    Lê a tabela uma vez e recalcula (e regrava) só os blocos ausentes, sujos
+    ou vencidos -- ou todos, com forcar=True. Bloco cujo cálculo falha fica de
+    fora do retorno (quem chama usa os zeros padrão) e NÃO é gravado. Se a
+    tabela ainda não existe, calcula tudo sem gravar. Retorna
+    (dados_por_bloco, blocos_recalculados).
+    """
+    cur = conn.cursor()
+    try:
+        try:
+            linhas = ler(cur, ano_mes, empresa_id)
+            persistir = True
+        except Exception:
+            logger.warning("[dashboard] leitura de dashboard_metricas falhou; calculando ao vivo",
+                           exc_info=True)
+            conn.rollback()
+            linhas, persistir = {}, False
+
+        dados, recalculados = {}, []
+        for bloco, calcular in calculos.items():
+            linha = linhas.get(bloco)
+            if not forcar and not _precisa_recalcular(linha):
+                dados[bloco] = linha['dados']
+                continue
+            try:
+                dados[bloco] = calcular()
+            except Exception:
+                logger.warning("[dashboard] bloco '%s' falhou", bloco, exc_info=True)
+                conn.rollback()
+                if linha is not None:
+                    dados[bloco] = linha['dados']   # melhor o valor anterior que zero
+                continue
+            recalculados.append(bloco)
+            if persistir:
+                try:
+                    gravar(cur, ano_mes, bloco, dados[bloco],
+                           linha['versao'] if linha else 0, empresa_id)
+                    conn.commit()
+                except Exception:
+                    logger.warning("[dashboard] gravar bloco '%s' falhou", bloco, exc_info=True)
+                    conn.rollback()
+        return dados, recalculados
+    finally:
+        cur.close()
+
+
+def invalidar(*tabelas):
+    """
+    Marca como sujos os blocos que dependem de `tabelas` (chaves de
+    BLOCOS_POR_TABELA) em todos os meses. Chamar DEPOIS do commit da
+    alteração. Conexão própria e nunca levanta: falha aqui só atrasa o
+    dashboard até o TTL.
+    """
+    blocos = sorted({b for t in tabelas for b in BLOCOS_POR_TABELA.get(t, ())})
+    if not blocos:
+        return
+    from utils.db import get_db_connection
+    conn = cur = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute(
+            "UPDATE dashboard_metricas SET sujo = 1, versao = versao + 1 "
+            f"WHERE bloco IN ({','.join(['%s'] * len(blocos))})",
+            blocos,
+        )
+        conn.commit()
+    except Exception as e:
+        logger.warning("[dashboard] invalidar %s falhou: %s", tabelas, e)
+    finally:
+        for c in (cur, conn):
+            try:
+                if c is not None:
+                    c.close()
+            except Exception:
+                pass
@@ -2,6 +2,8 @@ import mysql.connector
 from mysql.connector import pooling, Error
 from config import Config
 import logging
+import os
+import threading
 import time
 
 # Configure logging
@@ -9,11 +11,22 @@ logger = logging.getLogger(__name__)
 
 # Connection pool configuration
 _connection_pool = None
+# gthread workers (start.sh): several threads may hit the first checkout at
+# once; without the lock each one would build its own pool and all but the
+# last would leak their connections.
+_pool_lock = threading.Lock()
 
 # Reconnection constants
 RECONNECT_ATTEMPTS = 3
 RECONNECT_DELAY = 1  # seconds
 
+# Pool instrumentation thresholds (see pool_metrics()).
+HOLD_WARN_SECONDS = float(os.environ.get('DB_HOLD_WARN_SEC', 10))
+METRICS_LOG_INTERVAL = float(os.environ.get('DB_POOL_LOG_INTERVAL_SEC', 300))
+# When '1', get_db_connection() inside a request hands out the request-scoped
+# connection (see get_request_connection) instead of a new pool checkout.
+REQUEST_SCOPED_DEFAULT = os.environ.get('DB_REQUEST_SCOPED', '0') == '1'
+
 # Shared connection parameters for pool and fallback connections
 CONNECTION_PARAMS = {
     'host': Config.DB_HOST,
@@ -33,8 +46,13 @@ def _get_connection_pool():
     Uses singleton pattern to ensure only one pool exists.
     """
     global _connection_pool
-    
-    if _connection_pool is None:
+
+    if _connection_pool is not None:
+        return _connection_pool
+
+    with _pool_lock:
+        if _connection_pool is not None:
+            return _connection_pool
         try:
             pool_config = {
                 'pool_name': 'nh_transportes_pool',
@@ -53,13 +71,14 @@ def _get_connection_pool():
         except Error as e:
             logger.error(f"Error creating connection pool: {e}")
             raise
-    
+
     return _connection_pool
 
-def get_db_connection():
+def _checkout():
     """
-    Get a database connection from the pool.
+    Get a raw database connection from the pool.
     Falls back to a direct connection if the pool is unavailable.
+    Returns (connection, fallback_reason) -- reason is None for pooled ones.
     Pings the connection to detect and recover stale connections obtained
     from the pool (common when Railway proxy closes idle connections).
     
@@ -82,17 +101,306 @@ def get_db_connection():
             # to the direct-connection fallback below.
             raise
             
-        return connection
+        return connection, None
     except Error as e:
         logger.error(f"Error getting connection from pool: {e}")
         # Fallback to direct connection if pool fails
         logger.warning("Falling back to direct connection")
         for attempt in range(1, RECONNECT_ATTEMPTS + 1):
             try:
-                return mysql.connector.connect(**CONNECTION_PARAMS)
+                return mysql.connector.connect(**CONNECTION_PARAMS), type(e).__name__
             except Error as direct_err:
                 logger.warning(f"Direct connection attempt {attempt}/{RECONNECT_ATTEMPTS} failed: {direct_err}")
                 if attempt < RECONNECT_ATTEMPTS:
                     time.sleep(RECONNECT_DELAY)
         raise
 
+
+
+# ---------------------------------------------------------------------------
+# Pool instrumentation
+# ---------------------------------------------------------------------------
+
+class _PoolMetrics:
+    """
+    Per-process counters for connection checkouts (one set per gunicorn
+    worker, like the pool itself). Cheap enough to stay always on: one lock
+    and a handful of additions per checkout/close.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started_at = time.time()
+            self.checkouts = 0
+            self.fallbacks = 0
+            self.fallback_reasons = {}
+            self.failures = 0
+            self.wait_total = 0.0
+            self.wait_max = 0.0
+            self.hold_total = 0.0
+            self.hold_max = 0.0
+            self.hold_max_endpoint = None
+            self.released = 0
+            self.in_use = 0
+            self.in_use_peak = 0
+            self.shared_reuses = 0
+            self.endpoints = {}   # endpoint -> {'checkouts', 'hold_total', 'hold_max'}
+            self._last_log = time.monotonic()
+
+    def checkout(self, wait, fallback_reason):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            if fallback_reason:
+                self.fallbacks += 1
+                self.fallback_reasons[fallback_reason] = self.fallback_reasons.get(fallback_reason, 0) + 1
+            self.in_use += 1
+            self.in_use_peak = max(self.in_use_peak, self.in_use)
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+
+    def release(self, held, endpoint):
+        with self._lock:
+            self.released += 1
+            self.in_use = max(0, self.in_use - 1)
+            self.hold_total += held
+            if held > self.hold_max:
+                self.hold_max = held
+                self.hold_max_endpoint = endpoint
+            ep = self.endpoints.setdefault(endpoint or '-', {'checkouts': 0, 'hold_total': 0.0, 'hold_max': 0.0})
+            ep['checkouts'] += 1
+            ep['hold_total'] += held
+            ep['hold_max'] = max(ep['hold_max'], held)
+            due = time.monotonic() - self._last_log >= METRICS_LOG_INTERVAL
+            if due:
+                self._last_log = time.monotonic()
+        if held >= HOLD_WARN_SECONDS:
+            logger.warning(f"DB connection held for {held:.1f}s (endpoint: {endpoint or '-'})")
+        if due:
+            log_pool_metrics()
+
+    def snapshot(self, top=10):
+        with self._lock:
+            endpoints = sorted(
+                ({'endpoint': name,
+                  'checkouts': ep['checkouts'],
+                  'hold_avg_ms': round(ep['hold_total'] / ep['checkouts'] * 1000, 1),
+                  'hold_max_ms': round(ep['hold_max'] * 1000, 1),
+                  'hold_total_s': round(ep['hold_total'], 3)}
+                 for name, ep in self.endpoints.items()),
+                key=lambda e: e['hold_total_s'], reverse=True,
+            )
+            return {
+                'pid': os.getpid(),
+                'pool_size': Config.DB_POOL_SIZE,
+                'since': self.started_at,
+                'checkouts': self.checkouts,
+                'in_use': self.in_use,
+                'in_use_peak': self.in_use_peak,
+                'failures': self.failures,
+                'fallbacks': self.fallbacks,
+                'fallback_rate': round(self.fallbacks / self.checkouts, 4) if self.checkouts else 0.0,
+                'fallback_reasons': dict(self.fallback_reasons),
+                'wait_avg_ms': round(self.wait_total / self.checkouts * 1000, 2) if self.checkouts else 0.0,
+                'wait_max_ms': round(self.wait_max * 1000, 2),
+                'hold_avg_ms': round(self.hold_total / self.released * 1000, 1) if self.released else 0.0,
+                'hold_max_ms': round(self.hold_max * 1000, 1),
+                'hold_max_endpoint': self.hold_max_endpoint,
+                'shared_reuses': self.shared_reuses,
+                'top_endpoints': endpoints[:top],
+            }
+
+
+_metrics = _PoolMetrics()
+
+
+def pool_metrics(top=10):
+    """Snapshot of this process' pool counters (JSON-serializable dict)."""
+    return _metrics.snapshot(top=top)
+
+
+def reset_pool_metrics():
+    _metrics.reset()
+
+
+def log_pool_metrics():
+    m = _metrics.snapshot(top=3)
+    top = ', '.join(f"{e['endpoint']}={e['hold_total_s']}s" for e in m['top_endpoints']) or '-'
+    logger.info(
+        f"DB pool (pid {m['pid']}, size {m['pool_size']}): checkouts={m['checkouts']} "
+        f"in_use={m['in_use']} peak={m['in_use_peak']} fallbacks={m['fallbacks']} "
+        f"wait avg/max={m['wait_avg_ms']}/{m['wait_max_ms']}ms "
+        f"hold avg/max={m['hold_avg_ms']}/{m['hold_max_ms']}ms ({m['hold_max_endpoint']}) "
+        f"top: {top}"
+    )
+
+
+def _current_endpoint():
+    try:
+        from flask import has_request_context, request
+        if has_request_context():
+            return request.endpoint or request.path
+    except Exception:
+        pass
+    return None
+
+
+class _MeasuredConnection:
+    """
+    Thin proxy around a mysql.connector connection that reports how long it
+    was held when close() hands it back to the pool. Everything else is
+    delegated untouched (cursor(), commit(), rollback(), ...).
+    """
+
+    def __init__(self, connection, endpoint):
+        self._connection = connection
+        self._endpoint = endpoint
+        self._acquired = time.monotonic()
+        self._closed = False
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._connection.close()
+        finally:
+            _metrics.release(time.monotonic() - self._acquired, self._endpoint)
+
+
+def _new_connection():
+    endpoint = _current_endpoint()
+    started = time.monotonic()
+    try:
+        connection, fallback_reason = _checkout()
+    except Error:
+        _metrics.failure()
+        raise
+    _metrics.checkout(time.monotonic() - started, fallback_reason)
+    return _MeasuredConnection(connection, endpoint)
+
+
+# ---------------------------------------------------------------------------
+# Request-scoped connection
+# ---------------------------------------------------------------------------
+
+class _SharedConnection:
+    """
+    Handle to the request's connection (flask.g). Helpers use it exactly like
+    a pooled connection: close() only releases this handle. When the last
+    open handle is released the pending transaction is rolled back -- the same
+    thing the pool does on return (pool_reset_session), so uncommitted work
+    never leaks into the next helper and the MVCC snapshot is refreshed. The
+    real close happens in the teardown handler (see init_app).
+    """
+
+    def __init__(self, holder):
+        self._holder = holder
+        self._closed = False
+        holder['handles'] += 1
+
+    def __getattr__(self, name):
+        return getattr(self._holder['connection'], name)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._holder['handles'] -= 1
+        if self._holder['handles'] == 0:
+            try:
+                self._holder['connection'].rollback()
+            except Error as e:
+                logger.warning(f"Rollback on shared connection release failed: {e}")
+                _drop_request_connection()
+
+
+def _drop_request_connection(error=None):
+    from flask import g
+    holder = g.pop('_db_request_connection', None)
+    if not holder:
+        return
+    connection = holder['connection']
+    try:
+        if error is not None:
+            connection.rollback()
+    except Error:
+        pass
+    finally:
+        try:
+            connection.close()
+        except Error as e:
+            logger.warning(f"Error closing request-scoped connection: {e}")
+
+
+def get_request_connection():
+    """
+    Connection shared by every helper in the current request.
+
+    The first call checks a connection out of the pool and keeps it in
+    flask.g; later calls in the same request reuse it (no second checkout,
+    no nested connection). Callers keep the usual pattern -- cursor(),
+    commit()/rollback(), close() -- and the connection goes back to the pool
+    in the app-context teardown. Outside a request this is simply
+    get_db_connection().
+
+    Nested handles share ONE transaction: a commit()/rollback() in an inner
+    helper also applies to the outer one's pending work.
+    """
+    from flask import g, has_request_context
+    if not has_request_context():
+        return _new_connection()
+    holder = g.get('_db_request_connection')
+    if holder is None:
+        holder = {'connection': _new_connection(), 'handles': 0}
+        g._db_request_connection = holder
+    else:
+        with _metrics._lock:
+            _metrics.shared_reuses += 1
+    return _SharedConnection(holder)
+
+
+def init_app(app):
+    """Registers the teardown that returns the request connection to the pool."""
+    app.teardown_appcontext(_drop_request_connection)
+
+
+def get_db_connection():
+    """
+    Get a database connection from the pool (see _checkout for the
+    fallback/reconnect rules). Checkout wait, hold time, fallbacks and the
+    endpoint holding it are recorded in pool_metrics().
+
+    With DB_REQUEST_SCOPED=1, calls made inside a Flask request return the
+    request-scoped connection (get_request_connection) instead.
+
+    Returns:
+        A connection proxy; close() returns it to the pool.
+
+    Raises:
+        Error: If unable to get connection from pool or direct fallback
+    """
+    if REQUEST_SCOPED_DEFAULT and _current_endpoint() is not None:
+        return get_request_connection()
+    return _new_connection()
+
+
+def get_stream_connection():
+    """
+    A pool connection of its own, even with DB_REQUEST_SCOPED=1.
+
+    For unbuffered (streaming) cursors: the connection is tied up until the
+    last row is read, so it cannot be the request's shared connection, and
+    two streams cannot share one. close() returns it to the pool as usual.
+    """
+    return _new_connection()
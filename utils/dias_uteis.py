@@ -0,0 +1,78 @@
+"""
+utils/dias_uteis.py
+===================
+
+Calendário de dias úteis num array, para mapear data de venda -> data de
+liquidação esperada (conf_cartoes) sem andar dia a dia.
+
+Antes `_next_business_day(d, n, feriados)` avançava um dia por vez, com
+weekday() e um lookup de string ISO no set de feriados a cada passo, para
+CADA venda de CADA bandeira. Aqui o intervalo é montado uma vez por request:
+
+  - `_uteis`: ordinais dos dias úteis, em ordem;
+  - `_ate[i]`: quantos dias úteis há de `inicio` até `inicio + i`.
+
+O n-ésimo dia útil depois de d é `_uteis[_ate[d - inicio] + n - 1]`: dois
+índices, nenhum laço. O array cresce sozinho se a soma passar do fim.
+
+Feriados chegam como ISO 'YYYY-MM-DD' (conf_cartoes._get_feriados).
+"""
+from datetime import date, timedelta
+
+_BLOCO_DIAS = 62     # quanto o calendário cresce quando a soma passa do fim
+
+
+class CalendarioUteis:
+    """Dias úteis (seg-sex, fora os feriados) a partir de `inicio`."""
+
+    def __init__(self, feriados, inicio, fim=None):
+        self._feriados = set()
+        for f in feriados or ():
+            try:
+                self._feriados.add(date.fromisoformat(str(f)[:10]).toordinal())
+            except ValueError:
+                pass
+        self._base = inicio.toordinal()
+        self._uteis = []
+        self._ate = []
+        self._estender((fim or inicio).toordinal() + _BLOCO_DIAS)
+
+    def _estender(self, ate_ordinal):
+        o = self._base + len(self._ate)
+        uteis, ate, feriados = self._uteis, self._ate, self._feriados
+        while o <= ate_ordinal:
+            # date.weekday(): 0=seg ... 6=dom; toordinal() % 7: 1=seg ... 0=dom
+            if 0 < o % 7 < 6 and o not in feriados:
+                uteis.append(o)
+            ate.append(len(uteis))
+            o += 1
+
+    def somar(self, d, n):
+        """O n-ésimo dia útil depois de d (d não conta). n <= 0 devolve d.
+        Mesmo resultado de conf_cartoes._next_business_day."""
+        if n <= 0:
+            return d
+        i = d.toordinal() - self._base
+        if i < 0:
+            return _somar_laco(d, n, self._feriados)
+        if i >= len(self._ate):
+            self._estender(d.toordinal() + _BLOCO_DIAS)
+        k = self._ate[i] + n - 1
+        while k >= len(self._uteis):
+            self._estender(self._base + len(self._ate) + _BLOCO_DIAS)
+        return date.fromordinal(self._uteis[k])
+
+    def eh_util(self, d):
+        o = d.toordinal()
+        return 0 < o % 7 < 6 and o not in self._feriados
+
+
+def _somar_laco(d, n, feriados_ordinais):
+    """Dia a dia, para data antes do início do array (não acontece no relatório)."""
+    conta = 0
+    while conta < n:
+        d += timedelta(days=1)
+        o = d.toordinal()
+        if 0 < o % 7 < 6 and o not in feriados_ordinais:
+            conta += 1
+    return d
@@ -0,0 +1,224 @@
+"""
+utils/fifo.py
+=============
+
+Motor FIFO único do módulo Lucro Postos.
+
+Antes havia três cópias do mesmo algoritmo — `lucro_postos._calcular_fifo`
+(fechamento), `relatorios._calcular_fifo_relatorio` / `_consumir_fifo` /
+`_advance_layers_to_date` (relatório) e o laço inline do dashboard em
+`bases._calcular_lucro_fifo_dashboard` — todas guardando as camadas numa lista
+de dicts e consumindo com `layers.pop(0)`, O(n) por lote esgotado.
+
+Aqui as camadas ficam num `collections.deque` de registros com __slots__;
+esgotar o lote da frente é O(1). A aritmética é a mesma de antes, operação
+por operação, nos dois modos que o sistema usa:
+
+  - exato=True  → Decimal (fechamento do mês e resumo do relatório);
+  - exato=False → float (avanço desde a abertura, tabela diária, dashboard).
+
+Valores que já chegam como Decimal do banco não são reconvertidos via str().
+"""
+
+from collections import deque
+from decimal import Decimal
+
+_TOL_DECIMAL = Decimal('0.001')
+_TOL_FLOAT = 0.001
+
+
+def _para_decimal(v):
+    return v if type(v) is Decimal else Decimal(str(v))
+
+
+class Camada:
+    """Lote FIFO: quantidade restante e custo unitário."""
+
+    __slots__ = ('qtde', 'custo')
+
+    def __init__(self, qtde, custo):
+        self.qtde = qtde
+        self.custo = custo
+
+
+class FilaFifo:
+    """
+    Fila de camadas FIFO (mais antiga na frente).
+
+    camadas: iterável de {'qtde', 'custo'} — as de qtde <= 0 são descartadas,
+    como nos cálculos antigos.
+    """
+
+    __slots__ = ('_camadas', '_num', '_tol', '_zero')
+
+    def __init__(self, camadas=(), exato=False):
+        if exato:
+            self._num, self._tol, self._zero = _para_decimal, _TOL_DECIMAL, Decimal('0')
+        else:
+            self._num, self._tol, self._zero = float, _TOL_FLOAT, 0.0
+        self._camadas = deque()
+        self.redefinir(camadas)
+
+    def redefinir(self, camadas):
+        """Substitui o conteúdo da fila pelas `camadas` informadas."""
+        num = self._num
+        self._camadas = deque(
+            Camada(num(c['qtde']), num(c['custo']))
+            for c in camadas if float(c.get('qtde', 0)) > 0
+        )
+
+    def __len__(self):
+        return len(self._camadas)
+
+    def entrada(self, qtde, custo):
+        """Acrescenta um lote ao fim da fila (valores já convertidos)."""
+        self._camadas.append(Camada(qtde, custo))
+
+    def consumir(self, quantidade, cogs=None):
+        """
+        Consome `quantidade` das camadas mais antigas; retorna o COGS.
+
+        Com `cogs` informado o custo é somado a ele, parcela a parcela, e o
+        total acumulado é devolvido — mesma ordem de somas dos cálculos
+        antigos, que acumulavam direto no total do período.
+        Mesma tolerância de 0,001 dos cálculos antigos.
+        """
+        camadas = self._camadas
+        tol = self._tol
+        if cogs is None:
+            cogs = self._zero
+        restante = quantidade
+        while restante > tol and camadas:
+            camada = camadas[0]
+            if camada.qtde <= restante + tol:
+                cogs += camada.qtde * camada.custo
+                restante -= camada.qtde
+                camadas.popleft()
+            else:
+                cogs += restante * camada.custo
+                camada.qtde -= restante
+                restante = self._zero
+        return cogs
+
+    def qtde_total(self):
+        return sum(c.qtde for c in self._camadas)
+
+    def valor_total(self):
+        return sum(c.qtde * c.custo for c in self._camadas)
+
+    def custo_frente(self):
+        """Custo do lote mais antigo (0 se a fila estiver vazia)."""
+        return self._camadas[0].custo if self._camadas else self._zero
+
+    def camadas(self):
+        """Estado atual como lista de {'qtde', 'custo'} (para snapshot/JSON)."""
+        return [{'qtde': c.qtde, 'custo': c.custo} for c in self._camadas]
+
+
+def _por_data(linhas):
+    """Agrupa linhas com chave 'data' preservando a ordem dentro do dia."""
+    grupos = {}
+    for linha in sorted(linhas, key=lambda x: x['data']):
+        grupos.setdefault(linha['data'], []).append(linha)
+    return grupos
+
+
+def calcular(camadas_iniciais, compras, vendas, exato=True, serie=False):
+    """
+    Aplica compras e vendas de um produto, dia a dia, sobre as camadas iniciais.
+
+    camadas_iniciais: list of {'qtde', 'custo'}
+    compras: list of {'data', 'qtde', 'custo'}
+    vendas:  list of {'data', 'qtde', 'valor_total'}
+
+    Em cada data as compras entram antes das vendas. Com serie=True o
+    resultado inclui 'dias': [{'data', 'entrada', 'saida', 'cogs',
+    'estoque_qtde', 'estoque_valor'}] (valores em float).
+
+    Retorna: (resultado_dict, camadas_finais) — camadas como list of dicts.
+    """
+    fila = FilaFifo(camadas_iniciais, exato=exato)
+    num, zero = fila._num, fila._zero
+
+    qtde_entrada = zero
+    custo_entrada = zero
+    qtde_saida = zero
+    receita = zero
+    cogs = zero
+    dias = [] if serie else None
+
+    comp_by_date = _por_data(compras)
+    vend_by_date = _por_data(vendas)
+
+    for data in sorted(comp_by_date.keys() | vend_by_date.keys()):
+        entrada_dia = saida_dia = cogs_dia = zero
+        for comp in comp_by_date.get(data, ()):
+            qtde = num(comp['qtde'])
+            custo = num(comp['custo'])
+            if qtde > 0:
+                fila.entrada(qtde, custo)
+                qtde_entrada += qtde
+                custo_entrada += qtde * custo
+                entrada_dia += qtde
+
+        for vend in vend_by_date.get(data, ()):
+            qtde_vender = num(vend['qtde'])
+            valor = num(vend['valor_total'])
+            if qtde_vender <= 0:
+                continue
+            qtde_saida += qtde_vender
+            receita += valor
+            antes = cogs
+            cogs = fila.consumir(qtde_vender, cogs)
+            saida_dia += qtde_vender
+            cogs_dia += cogs - antes
+
+        if serie:
+            dias.append({
+                'data': data,
+                'entrada': float(entrada_dia),
+                'saida': float(saida_dia),
+                'cogs': float(cogs_dia),
+                'estoque_qtde': float(fila.qtde_total()),
+                'estoque_valor': float(fila.valor_total()),
+            })
+
+    estoque_final_qtde = fila.qtde_total()
+    estoque_final_valor = fila.valor_total()
+
+    resultado = {
+        'qtde_entrada': float(qtde_entrada),
+        'custo_entrada_total': float(custo_entrada),
+        'custo_entrada_unit': float(custo_entrada / qtde_entrada) if qtde_entrada > 0 else 0.0,
+        'qtde_saida': float(qtde_saida),
+        'receita_saida': float(receita),
+        'preco_medio_saida': float(receita / qtde_saida) if qtde_saida > 0 else 0.0,
+        'cogs': float(cogs),
+        'lucro': float(receita - cogs),
+        'estoque_final_qtde': float(estoque_final_qtde),
+        'estoque_final_valor': float(estoque_final_valor),
+        'estoque_final_custo_unit': float(estoque_final_valor / estoque_final_qtde) if estoque_final_qtde > 0 else 0.0,
+    }
+    if serie:
+        resultado['dias'] = dias
+    return resultado, fila.camadas()
+
+
+def avancar(fila, compras, vendas_por_data):
+    """
+    Avança `fila` pelos movimentos de um intervalo, sem apurar resultado.
+
+    compras: linhas {'data', 'qtde', 'custo'} (só entram as com qtde e custo > 0);
+    vendas_por_data: {data: litros vendidos no dia}.
+    Usado para levar as camadas da abertura até o início do período.
+    """
+    num = fila._num
+    comp_by_date = _por_data(compras)
+    for d in sorted(comp_by_date.keys() | vendas_por_data.keys()):
+        for comp in comp_by_date.get(d, ()):
+            qtde, custo = num(comp['qtde']), num(comp['custo'])
+            if qtde > 0 and custo > 0:
+                fila.entrada(qtde, custo)
+        qtde_v = vendas_por_data.get(d, 0)
+        if qtde_v > 0:
+            fila.consumir(num(qtde_v))
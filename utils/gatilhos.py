@@ -0,0 +1,51 @@
+"""
+Gatilhos (TRIGGER) criados na partida, e só quando faltam ou mudaram.
+
+O MySQL não tem CREATE TRIGGER IF NOT EXISTS nem OR REPLACE, e o costume era
+DROP + CREATE a cada partida. Entre um e outro a tabela fica sem gatilho (a
+gravação que cair ali não marca nada), e a DDL pede lock de metadados na
+tabela vigiada -- em bank_transactions, espera atrás de qualquer importação
+de OFX em andamento e trava quem chega depois.
+
+sincronizar_gatilhos compara cada CREATE TRIGGER com o que está em
+information_schema.TRIGGERS (momento, evento, tabela e corpo, sem diferença
+de espaços) e só refaz o que difere. Roda na partida, que já é serializada
+entre os workers (utils/partida.py).
+"""
+import re
+
+_RE_CREATE = re.compile(
+    r"CREATE\s+TRIGGER\s+`?(\w+)`?\s+(BEFORE|AFTER)\s+(INSERT|UPDATE|DELETE)"
+    r"\s+ON\s+`?(\w+)`?\s+FOR\s+EACH\s+ROW\s+(.*)\Z", re.I | re.S)
+
+
+def _normal(sql):
+    if isinstance(sql, (bytes, bytearray)):
+        sql = sql.decode('utf-8')
+    return ' '.join(sql.split())
+
+
+def _assinatura(momento, evento, tabela, corpo):
+    return momento.upper(), evento.upper(), tabela.lower(), _normal(corpo)
+
+
+def sincronizar_gatilhos(cur, ddls):
+    """Cria/refaz os gatilhos de `ddls` (CREATE TRIGGER ...) que faltam ou
+    mudaram. Devolve os nomes refeitos; quem chama faz o commit."""
+    cur.execute("""SELECT TRIGGER_NAME, ACTION_TIMING, EVENT_MANIPULATION,
+                          EVENT_OBJECT_TABLE, ACTION_STATEMENT
+                     FROM information_schema.TRIGGERS
+                    WHERE TRIGGER_SCHEMA = DATABASE()""")
+    atuais = {r[0]: _assinatura(*r[1:]) for r in cur.fetchall()}
+    refeitos = []
+    for ddl in ddls:
+        m = _RE_CREATE.match(ddl.strip())
+        if not m:
+            raise ValueError('não é CREATE TRIGGER: %s' % _normal(ddl)[:80])
+        nome = m.group(1)
+        if atuais.get(nome) == _assinatura(*m.groups()[1:]):
+            continue
+        cur.execute("DROP TRIGGER IF EXISTS `%s`" % nome)
+        cur.execute(ddl)
+        refeitos.append(nome)
+    return refeitos
@@ -42,8 +42,12 @@ def run_pending_migrations(app):
     Scan migrations/ directory, compare against schema_migrations table, and
     execute any files not yet recorded as successful.  Safe to call on every
     startup — already-applied migrations are skipped.
+
+    Afterwards runs the registered route schema checks once per process
+    (utils.schema_registry.garantir_todas).
     """
     from utils.db import get_db_connection
+    from utils.schema_registry import garantir_todas
 
     try:
         conn = get_db_connection()
@@ -59,29 +63,26 @@ def run_pending_migrations(app):
 
         if not os.path.isdir(MIGRATIONS_DIR):
             app.logger.warning("[migrations] Diretório não encontrado: %s", MIGRATIONS_DIR)
-            cur.close()
-            conn.close()
-            return
-
-        all_sql = sorted(f for f in os.listdir(MIGRATIONS_DIR) if f.endswith('.sql'))
-        pending = [f for f in all_sql if f not in applied]
+            pending = []
+        else:
+            all_sql = sorted(f for f in os.listdir(MIGRATIONS_DIR) if f.endswith('.sql'))
+            pending = [f for f in all_sql if f not in applied]
 
         if not pending:
             app.logger.info("[migrations] Nenhuma migration pendente.")
-            cur.close()
-            conn.close()
-            return
-
-        app.logger.info("[migrations] %d migration(s) pendente(s): %s", len(pending), pending)
-
-        applied_count = 0
-        for name in pending:
-            _run_one(app, conn, cur, name)
-            applied_count += 1
+        else:
+            app.logger.info("[migrations] %d migration(s) pendente(s): %s", len(pending), pending)
+            for name in pending:
+                _run_one(app, conn, cur, name)
+            app.logger.info("[migrations] Concluído: %d migration(s) processada(s).", len(pending))
 
         cur.close()
+
+        # After the .sql files: the routes' _ensure_*/_garante_* schema checks,
+        # once per process, so request handlers no longer probe
+        # information_schema on every request (utils/schema_registry.py).
+        garantir_todas(conn)
         conn.close()
-        app.logger.info("[migrations] Concluído: %d migration(s) processada(s).", applied_count)
 
     except Exception:
         app.logger.warning(
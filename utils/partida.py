@@ -0,0 +1,116 @@
+"""
+Partida do app (create_app): cronômetro das etapas e a manutenção de schema
+fora do caminho do gunicorn.
+
+Antes create_app importava as rotas, aplicava as migrations, rodava as
+garantias/correções de bank_import, as seeds e ligava os schedulers, tudo
+antes do worker aceitar a primeira request. Agora:
+
+  - as rotas continuam sendo registradas na partida (url_for e o roteamento
+    precisam delas), mas cada import é cronometrado;
+  - a manutenção (migrations + garantias + correções) roda numa thread, UMA
+    por vez entre os workers (GET_LOCK no MySQL): o primeiro worker aplica; o
+    segundo espera o lock e encontra tudo feito (só lê schema_migrations e
+    schema_garantias). Request que chegar antes chama a sua garantia sozinha
+    -- o registro (utils/schema_registry.py) cuida disso;
+  - ao fim, um relatório no log: import por módulo e tempo de cada etapa.
+
+STARTUP_DDL (env): 'background' (padrão), 'sync' (como antes, bloqueando --
+útil em script/teste) ou 'off' (não roda nada; outra instância cuida).
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+MODO = os.environ.get('STARTUP_DDL', 'background').strip().lower()
+_LOCK_NOME = 'nh_manutencao_schema'
+_LOCK_ESPERA_SEG = int(os.environ.get('STARTUP_DDL_LOCK_SEG', 600))
+
+
+class Cronometro:
+    """Acumula (etapa, ms) e imprime o relatório da partida."""
+
+    def __init__(self, titulo):
+        self.titulo = titulo
+        self.etapas = []
+        self._t0 = time.perf_counter()
+
+    @contextmanager
+    def etapa(self, nome):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.etapas.append((nome, (time.perf_counter() - t0) * 1000))
+
+    def relatorio(self, log, top=None):
+        total = (time.perf_counter() - self._t0) * 1000
+        linhas = sorted(self.etapas, key=lambda e: -e[1]) if top else self.etapas
+        log.info("[partida] %s: %.0f ms (%d etapa(s))", self.titulo, total, len(self.etapas))
+        for nome, ms in linhas[:top]:
+            log.info("[partida]   %8.1f ms  %s", ms, nome)
+
+
+@contextmanager
+def _lock_manutencao():
+    """GET_LOCK com espera: serializa a manutenção entre os workers."""
+    from utils.db import get_db_connection
+    conn = get_db_connection()
+    cur = conn.cursor()
+    ok = False
+    try:
+        cur.execute("SELECT GET_LOCK(%s, %s)", (_LOCK_NOME, _LOCK_ESPERA_SEG))
+        row = cur.fetchone()
+        ok = bool(row and row[0] == 1)
+        yield ok
+    finally:
+        try:
+            if ok:
+                cur.execute("SELECT RELEASE_LOCK(%s)", (_LOCK_NOME,))
+                cur.fetchall()
+        except Exception:
+            pass
+        cur.close()
+        conn.close()
+
+
+def rodar_manutencao(app, etapas, depois=()):
+    """Roda `etapas` [(nome, fn)] sob o lock e depois `depois` [(nome, fn)]
+    (schedulers: só ligam com o schema em dia). Cada fn recebe o app; falha
+    de uma não impede as outras. Em background devolve a Thread."""
+    if MODO == 'off':
+        app.logger.info("[partida] STARTUP_DDL=off: manutenção de schema não roda aqui.")
+        etapas = ()
+
+    def _rodar():
+        cron = Cronometro('manutenção de schema')
+        with app.app_context():
+            try:
+                if etapas:
+                    with _lock_manutencao() as ok:
+                        if not ok:
+                            app.logger.warning("[partida] sem o lock de manutenção em %ds; seguindo.",
+                                               _LOCK_ESPERA_SEG)
+                        _executar(app, cron, etapas)
+            except Exception:
+                app.logger.warning("[partida] manutenção de schema falhou (não crítico).",
+                                   exc_info=True)
+            _executar(app, cron, depois)
+        cron.relatorio(app.logger)
+
+    if MODO == 'sync':
+        _rodar()
+        return None
+    t = threading.Thread(target=_rodar, name='manutencao-schema', daemon=True)
+    t.start()
+    return t
+
+
+def _executar(app, cron, etapas):
+    for nome, fn in etapas:
+        try:
+            with cron.etapa(nome):
+                fn(app)
+        except Exception:
+            app.logger.warning("[partida] etapa %s falhou (não crítico).", nome, exc_info=True)
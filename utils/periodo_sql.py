@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""Filtros de data SARGABLE (semiabertos) para o SQL dos relatórios.
+
+`YEAR(col)=%s AND MONTH(col)=%s`, `DATE(col) = %s` e `DATE(col) BETWEEN %s AND
+%s` aplicam função na coluna: o MySQL não consegue usar índice nenhum e varre
+a tabela inteira. A mesma condição escrita como intervalo semiaberto
+
+    col >= <início> AND col < <fim exclusivo>
+
+dá o MESMO resultado para colunas DATE e DATETIME e usa o índice de `col`
+(inclusive como última coluna de um índice composto, ex.
+vendas_posto(cliente_id, produto_id, data_movimento)).
+
+Módulo PURO (sem Flask, sem banco), como utils.fuso. As funções intervalo_*
+devolvem (início, fim exclusivo) para os parâmetros de `col >= %s AND col < %s`.
+"""
+from datetime import date, datetime, timedelta
+
+
+def _como_data(v):
+    """date, datetime ou 'YYYY-MM-DD[...]' -> date."""
+    if isinstance(v, datetime):
+        return v.date()
+    if isinstance(v, date):
+        return v
+    return date.fromisoformat(str(v)[:10])
+
+
+def intervalo_mes(ano, mes):
+    """[1º dia do mês, 1º dia do mês seguinte)."""
+    ini = date(int(ano), int(mes), 1)
+    fim = date(ini.year + 1, 1, 1) if ini.month == 12 else date(ini.year, ini.month + 1, 1)
+    return ini, fim
+
+
+def intervalo_periodo(ini, fim):
+    """Período de DIAS inclusivo [ini, fim] como [ini, fim + 1 dia)."""
+    return _como_data(ini), _como_data(fim) + timedelta(days=1)
+
+
+def intervalo_dia(dia):
+    return intervalo_periodo(dia, dia)
+
@@ -0,0 +1,218 @@
+"""
+utils/regras_conciliacao.py
+===========================
+
+Índice compilado das regras de conciliação automática (bank_conciliacao_regras).
+
+O laço antigo de `_auto_conciliar_por_regras` testava cada transação pendente
+contra cada regra ativa, refazendo o `.upper()` dos padrões a cada volta:
+O(transações × regras) a cada upload de OFX. Aqui as regras viram um índice
+montado uma vez por versão do conjunto de regras e guardado por worker:
+
+  - um autômato Aho-Corasick (trie + links de falha) com todos os padrões
+    'contem' e secundários — uma passada pela descrição diz quais padrões
+    aparecem nela;
+  - as regras 'exato' num dict particionado por (conta, tipo de transação).
+
+A ordem continua a mesma da query (conta específica antes da genérica,
+composta antes da simples, depois id): entre as candidatas, vence a de menor
+posição — exatamente a "primeira regra que bate" do laço antigo.
+
+A "versão" é a assinatura dos campos que decidem o casamento. As regras são
+relidas do banco a cada execução (uma query pequena), então uma regra editada
+em outro worker muda a assinatura e o índice é recompilado sem invalidação
+explícita.
+"""
+
+import threading
+
+# Campos da regra que decidem o casamento. Os demais (forma, fornecedor,
+# título...) são lidos da linha atual pelo chamador, pela posição devolvida.
+_CAMPOS_ASSINATURA = (
+    'id', 'account_id', 'tipo_transacao', 'tipo_match',
+    'padrao_descricao', 'padrao_secundario',
+)
+
+_cache_lock = threading.Lock()
+_cache = {'assinatura': None, 'indice': None}
+
+
+def _conta_da_regra(regra):
+    """Conta da regra como int, ou None se genérica (0/NULL valem genérica)."""
+    acc = regra.get('account_id')
+    return int(acc) if acc else None
+
+
+def _tipo_da_regra(regra):
+    """tipo_transacao como o laço antigo o lia (NULL não é 'AMBOS')."""
+    return regra.get('tipo_transacao', 'AMBOS')
+
+
+class _AhoCorasick:
+    """Autômato Aho-Corasick mínimo sobre strings já em maiúsculas.
+
+    `ocorrencias(texto)` devolve o conjunto de ids dos padrões que aparecem
+    em `texto` (como substring), numa única passada.
+    """
+
+    __slots__ = ('_goto', '_falha', '_saida')
+
+    def __init__(self, padroes):
+        # padroes: dict padrao -> id
+        goto = [{}]
+        saida = [()]
+        for padrao, pid in padroes.items():
+            no = 0
+            for ch in padrao:
+                prox = goto[no].get(ch)
+                if prox is None:
+                    prox = len(goto)
+                    goto[no][ch] = prox
+                    goto.append({})
+                    saida.append(())
+                no = prox
+            saida[no] = saida[no] + (pid,)
+
+        # BFS para os links de falha; a saída de cada nó já inclui a do seu
+        # link de falha, então a busca não precisa subir a cadeia.
+        falha = [0] * len(goto)
+        fila = list(goto[0].values())
+        i = 0
+        while i < len(fila):
+            no = fila[i]
+            i += 1
+            for ch, filho in goto[no].items():
+                f = falha[no]
+                while f and ch not in goto[f]:
+                    f = falha[f]
+                alvo = goto[f].get(ch, 0)
+                falha[filho] = alvo if alvo != filho else 0
+                if saida[falha[filho]]:
+                    saida[filho] = saida[filho] + saida[falha[filho]]
+                fila.append(filho)
+
+        self._goto = goto
+        self._falha = falha
+        self._saida = saida
+
+    def ocorrencias(self, texto):
+        goto, falha, saida = self._goto, self._falha, self._saida
+        achados = set()
+        no = 0
+        for ch in texto:
+            while no and ch not in goto[no]:
+                no = falha[no]
+            no = goto[no].get(ch, 0)
+            if saida[no]:
+                achados.update(saida[no])
+        return achados
+
+
+class IndiceRegras:
+    """Regras ativas compiladas para casamento rápido.
+
+    `regras` deve vir na ordem de prioridade (a mesma ORDER BY de
+    `_auto_conciliar_por_regras`); `primeira()` devolve a posição da regra
+    vencedora nessa lista, ou None.
+    """
+
+    def __init__(self, regras):
+        padroes = {}  # padrao (upper) -> id no autômato
+
+        def _pid(p):
+            if p not in padroes:
+                padroes[p] = len(padroes)
+            return padroes[p]
+
+        # Cada regra vira (posição, conta, tipo, id do secundário ou None).
+        self._filtros = []
+        # 'contem' por id de padrão principal -> posições (ordem crescente)
+        self._por_padrao = {}
+        # 'contem' com padrão vazio: casam com qualquer descrição
+        self._sempre = []
+        # 'exato' particionadas: (conta, tipo_regra) -> {padrao: [posições]}
+        self._exatas = {}
+
+        for pos, regra in enumerate(regras):
+            conta = _conta_da_regra(regra)
+            tipo_regra = _tipo_da_regra(regra)
+            padrao = (regra.get('padrao_descricao') or '').upper()
+            padrao2 = (regra.get('padrao_secundario') or '').upper()
+            sec = _pid(padrao2) if padrao2 else None
+            self._filtros.append((conta, tipo_regra, sec))
+
+            if regra.get('tipo_match', 'contem') == 'exato':
+                part = self._exatas.setdefault((conta, tipo_regra), {})
+                part.setdefault(padrao, []).append(pos)
+            elif padrao:
+                self._por_padrao.setdefault(_pid(padrao), []).append(pos)
+            else:
+                self._sempre.append(pos)
+
+        self._automato = _AhoCorasick(padroes)
+        self.total = len(regras)
+
+    def primeira(self, descricao, tipo, account_id):
+        """Posição da primeira regra (em prioridade) que casa com a transação."""
+        descricao = (descricao or '').upper()
+        tipo = tipo or ''
+        account_id = int(account_id)
+        achados = self._automato.ocorrencias(descricao)
+
+        candidatas = list(self._sempre)
+        por_padrao = self._por_padrao
+        for pid in achados:
+            lista = por_padrao.get(pid)
+            if lista:
+                candidatas.extend(lista)
+        for chave in ((account_id, tipo), (account_id, 'AMBOS'),
+                      (None, tipo), (None, 'AMBOS')):
+            part = self._exatas.get(chave)
+            if part:
+                lista = part.get(descricao)
+                if lista:
+                    candidatas.extend(lista)
+        if not candidatas:
+            return None
+
+        filtros = self._filtros
+        for pos in sorted(candidatas):
+            conta, tipo_regra, sec = filtros[pos]
+            if conta is not None and conta != account_id:
+                continue
+            if tipo_regra != 'AMBOS' and tipo_regra != tipo:
+                continue
+            if sec is not None and sec not in achados:
+                continue
+            return pos
+        return None
+
+
+def _assinatura(regras):
+    return hash(tuple(
+        tuple(r.get(c) for c in _CAMPOS_ASSINATURA) for r in regras
+    ))
+
+
+def indice_para(regras):
+    """Índice compilado para `regras`, reaproveitado enquanto elas não mudarem.
+
+    Um índice por worker: a assinatura do conjunto atual é comparada com a do
+    índice em cache e só recompila quando diferem.
+    """
+    assinatura = _assinatura(regras)
+    with _cache_lock:
+        if _cache['assinatura'] == assinatura and _cache['indice'] is not None:
+            return _cache['indice']
+    indice = IndiceRegras(regras)
+    with _cache_lock:
+        _cache['assinatura'] = assinatura
+        _cache['indice'] = indice
+    return indice
+
+
+def invalidar_cache():
+    """Descarta o índice em cache (a próxima chamada recompila)."""
+    with _cache_lock:
+        _cache['assinatura'] = None
+        _cache['indice'] = None
@@ -0,0 +1,240 @@
+"""
+Saldo de tanque de HOJE mantido em memória, por processo, para
+/estoque/tempo-real, o card "Estoque · Agora" da home e o stream SSE
+(/estoque/tempo-real/stream).
+
+    saldo = Abertura de hoje + Recebido hoje (descarga) - Vendas hoje
+
+por (cliente_id, produto_id), "hoje" = America/Sao_Paulo. Antes cada acesso
+rodava os três agregados (leitura_tanque_diaria, descargas_pendentes,
+vendas_xml_itens) e as telas eram recarregadas o dia todo.
+
+Como fica:
+  - SEMENTE: os três agregados, na primeira leitura do dia. Repete a cada
+    ESTOQUE_TR_RESEMEAR_SEG como rede de segurança para o que não é
+    acréscimo (nota cancelada, descarga corrigida/excluída, item
+    classificado depois) e para o id que comitou fora de ordem.
+  - INCREMENTO: depois da semente, só as linhas NOVAS -- vendas_xml_itens e
+    descargas_pendentes com id acima da marca, faixa da PK. A abertura é um
+    punhado de linhas por dia e a leitura é gravada com upsert (o id não
+    anda), então ela é recontada inteira quando MAX(id) de
+    leitura_tanque_diaria muda.
+  - AVISO: quem grava (POST /api/vendas, els_email, descarga manual) chama
+    notificar() depois do commit; o processo atualiza já e acorda os
+    streams. Os OUTROS workers do gunicorn percebem no próximo ciclo
+    (ESTOQUE_TR_CICLO_SEG) pelas marcas -- três MAX(id), nunca os agregados.
+
+Cada (cliente, produto) guarda a `versao` em que mudou; o stream manda só as
+linhas com versao maior que a última que o navegador recebeu.
+
+Recebe CURSOR dictionary=True aberto; NÃO faz commit.
+"""
+import os
+import threading
+import time
+
+from utils.cnpj_digitos import digitos
+from utils.periodo_sql import intervalo_dia
+
+CICLO_SEG = float(os.environ.get('ESTOQUE_TR_CICLO_SEG', 5))
+RESEMEAR_SEG = int(os.environ.get('ESTOQUE_TR_RESEMEAR_SEG', 10 * 60))
+
+_SQL_MARCAS = (
+    "SELECT (SELECT COALESCE(MAX(id), 0) FROM vendas_xml_itens) AS venda, "
+    "(SELECT COALESCE(MAX(id), 0) FROM descargas_pendentes) AS descarga, "
+    "(SELECT COALESCE(MAX(id), 0) FROM leitura_tanque_diaria) AS leitura"
+)
+
+_SQL_ABERTURA = """
+    SELECT l.cliente_id, l.produto_id AS pid, SUM(l.volume_atual) AS litros,
+           GROUP_CONCAT(DISTINCT l.tanque ORDER BY l.tanque) AS tanques
+    FROM leitura_tanque_diaria l
+    WHERE UPPER(TRIM(l.titulo)) = 'ABERTURA'
+      AND l.produto_id IN ({ids})
+      AND l.data_leitura >= %s AND l.data_leitura < %s
+    GROUP BY l.cliente_id, pid
+"""
+
+# Recebido e vendas: (ini_dia, fim_dia, id_de, id_ate). A semente usa
+# id_de = 0; o incremento, a marca anterior.
+_SQL_RECEBIDO = """
+    SELECT d.cliente_id, d.produto_id AS pid, SUM(d.total_descarga) AS litros
+    FROM descargas_pendentes d
+    WHERE d.produto_id IN ({ids})
+      AND COALESCE(d.data_descarga, d.data_final, d.data_inicial) >= %s
+      AND COALESCE(d.data_descarga, d.data_final, d.data_inicial) < %s
+      AND d.id > %s AND d.id <= %s
+    GROUP BY d.cliente_id, pid
+"""
+
+_SQL_VENDAS = """
+    SELECT cl.id AS cliente_id, i.produto_id AS pid, SUM(i.quantidade) AS litros
+    FROM vendas_xml_itens i
+    JOIN vendas_xml v ON v.id = i.venda_id
+    JOIN clientes cl ON {cnpj_cl} = v.cnpj_emitente
+    WHERE i.produto_id IN ({ids})
+      AND i.unidade = 'L'
+      AND v.situacao <> 'cancelada'
+      AND v.dh_emissao >= %s AND v.dh_emissao < %s
+      AND i.id > %s AND i.id <= %s
+    GROUP BY cl.id, pid
+"""
+
+
+def _linhas(cur):
+    for r in cur.fetchall():
+        yield (r['cliente_id'], r['pid']), r
+
+
+class SaldoTempoReal:
+    """Totais do dia de UM processo. Thread-safe (gunicorn gthread)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()          # uma atualização por vez
+        self._mudou = threading.Condition()    # acorda os streams
+        self.dia = None
+        self.linhas = {}     # (cid, pid) -> {'abriu', 'tanques', 'rec', 'ven', 'versao'}
+        self.marcas = {'venda': 0, 'descarga': 0, 'leitura': 0}
+        self.versao = 0
+        self._semeado_em = None
+        self._atualizado_em = None
+        self._pendente = None   # None | 'incremento' | 'semente'
+
+    # ---------------------------------------------------------------- leitura
+    def _abertura(self, cur, ini, fim, ids):
+        cur.execute(_SQL_ABERTURA.format(ids=ids), (ini, fim))
+        return {k: (float(r['litros'] or 0), r['tanques']) for k, r in _linhas(cur)}
+
+    def _somas(self, cur, sql, ini, fim, de, ate, ids):
+        if ate <= de:
+            return {}
+        cur.execute(sql.format(ids=ids, cnpj_cl=digitos('clientes', 'cl')),
+                    (ini, fim, de, ate))
+        return {k: float(r['litros'] or 0) for k, r in _linhas(cur)}
+
+    def _marcas(self, cur):
+        cur.execute(_SQL_MARCAS)
+        r = cur.fetchone() or {}
+        if not isinstance(r, dict):
+            r = dict(zip(('venda', 'descarga', 'leitura'), r))
+        return {k: int(r.get(k) or 0) for k in ('venda', 'descarga', 'leitura')}
+
+    # ------------------------------------------------------------ atualização
+    def _gravar(self, chave, **valores):
+        atual = self.linhas.get(chave) or {'abriu': None, 'tanques': None,
+                                           'rec': 0.0, 'ven': 0.0, 'versao': 0}
+        if all(atual[k] == v for k, v in valores.items()) and chave in self.linhas:
+            return False
+        atual.update(valores)
+        atual['versao'] = self.versao + 1
+        self.linhas[chave] = atual
+        return True
+
+    def _semear(self, cur, hoje, ids):
+        ini, fim = intervalo_dia(hoje)
+        marcas = self._marcas(cur)
+        abertura = self._abertura(cur, ini, fim, ids)
+        recebido = self._somas(cur, _SQL_RECEBIDO, ini, fim, 0, marcas['descarga'], ids)
+        vendas = self._somas(cur, _SQL_VENDAS, ini, fim, 0, marcas['venda'], ids)
+
+        if self.dia != hoje:
+            self.linhas = {}
+        mudou = False
+        for chave in set(abertura) | set(recebido) | set(vendas) | set(self.linhas):
+            abriu, tanques = abertura.get(chave, (None, None))
+            mudou |= self._gravar(chave, abriu=abriu, tanques=tanques,
+                                  rec=recebido.get(chave, 0.0), ven=vendas.get(chave, 0.0))
+        self.dia, self.marcas = hoje, marcas
+        self._semeado_em = time.monotonic()
+        return mudou
+
+    def _incrementar(self, cur, hoje, ids):
+        ini, fim = intervalo_dia(hoje)
+        marcas = self._marcas(cur)
+        antes = self.marcas
+        mudou = False
+        if marcas['leitura'] != antes['leitura']:
+            abertura = self._abertura(cur, ini, fim, ids)
+            for chave in set(abertura) | set(self.linhas):
+                abriu, tanques = abertura.get(chave, (None, None))
+                mudou |= self._gravar(chave, abriu=abriu, tanques=tanques)
+        for chave, litros in self._somas(cur, _SQL_RECEBIDO, ini, fim,
+                                         antes['descarga'], marcas['descarga'], ids).items():
+            atual = self.linhas.get(chave, {}).get('rec', 0.0)
+            mudou |= self._gravar(chave, rec=atual + litros)
+        for chave, litros in self._somas(cur, _SQL_VENDAS, ini, fim,
+                                         antes['venda'], marcas['venda'], ids).items():
+            atual = self.linhas.get(chave, {}).get('ven', 0.0)
+            mudou |= self._gravar(chave, ven=atual + litros)
+        self.marcas = marcas
+        return mudou
+
+    def precisa_atualizar(self, hoje):
+        agora = time.monotonic()
+        return (self.dia != hoje or self._pendente is not None
+                or agora - self._semeado_em >= RESEMEAR_SEG
+                or agora - self._atualizado_em >= CICLO_SEG)
+
+    def atualizar(self, cur, hoje, produtos):
+        """Semente ou incremento, conforme o que estiver vencido/pendente.
+        Sem nada a fazer, não toca no banco."""
+        with self._lock:
+            if not self.precisa_atualizar(hoje):
+                return
+            ids = ",".join(str(int(p)) for p in produtos)
+            pendente, self._pendente = self._pendente, None
+            try:
+                if (self.dia != hoje or pendente == 'semente'
+                        or time.monotonic() - self._semeado_em >= RESEMEAR_SEG):
+                    mudou = self._semear(cur, hoje, ids)
+                else:
+                    mudou = self._incrementar(cur, hoje, ids)
+            except Exception:
+                self._pendente = self._pendente or pendente
+                raise
+            self._atualizado_em = time.monotonic()
+            if mudou:
+                with self._mudou:
+                    self.versao += 1
+                    self._mudou.notify_all()
+
+    def notificar(self, semear=False):
+        """Chamar DEPOIS do commit de quem gravou venda/descarga/abertura.
+        semear=True quando a gravação não é acréscimo (cancelamento, correção,
+        exclusão). Nunca levanta e não toca no banco."""
+        with self._mudou:
+            if semear or self._pendente is None:
+                self._pendente = 'semente' if semear else 'incremento'
+            self._mudou.notify_all()
+
+    # ------------------------------------------------------------------ saída
+    def _card(self, chave, ln):
+        cid, pid = chave
+        abriu = ln['abriu']
+        return {
+            'cliente_id': cid, 'pid': pid, 'versao': ln['versao'],
+            'tanques': ln['tanques'], 'abriu': abriu, 'rec': ln['rec'], 'ven': ln['ven'],
+            'saldo': (abriu + ln['rec'] - ln['ven']) if abriu is not None else None,
+        }
+
+    def cards(self, cliente_id=None, desde=0):
+        """(versao, [linhas com versao > desde]) de uma empresa ou de todas."""
+        with self._lock:
+            return self.versao, [
+                self._card(k, ln) for k, ln in self.linhas.items()
+                if ln['versao'] > desde and (cliente_id is None or k[0] == cliente_id)
+            ]
+
+    def esperar(self, versao, timeout):
+        """Bloqueia até sair versão nova, chegar aviso ou vencer o timeout."""
+        with self._mudou:
+            self._mudou.wait_for(lambda: self.versao > versao or self._pendente is not None,
+                                 timeout)
+
+
+SALDO = SaldoTempoReal()
+
+
+def notificar(semear=False):
+    """Atalho para os ganchos (vendas_api, els_email, estoque)."""
+    SALDO.notificar(semear=semear)
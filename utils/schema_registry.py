@@ -0,0 +1,167 @@
+"""
+Registro das garantias de schema (_ensure_* / _garante_*) das rotas.
+
+Cada rota tinha a sua função idempotente -- CREATE TABLE IF NOT EXISTS,
+consulta no information_schema, ALTER se faltar -- chamada no começo do
+handler, em TODA request (exportar_contabil chamava quatro antes de começar).
+Algumas tinham flag de módulo, a maioria não.
+
+Como fica:
+  - a função ganha o decorador @garantia (opcionalmente com versao=N);
+  - na PARTIDA, run_pending_migrations aplica os .sql e depois chama
+    garantir_todas(): um SELECT em schema_garantias diz quais já foram
+    verificadas nesta versão (essas nem rodam); as outras rodam uma vez e são
+    gravadas;
+  - depois disso, chamar a função no handler é só checar um atributo em
+    memória: nenhum round-trip ao banco.
+
+Mudou a DDL de uma garantia? Suba o `versao` no decorador: a próxima partida
+roda de novo e regrava. persistir=False é para o que precisa rodar uma vez
+por PROCESSO mesmo já verificado (reparo de dados), nunca só uma vez na vida.
+
+Falha (exceção ou retorno False) não fica memorizada: a próxima chamada tenta
+de novo, como antes. A função decorada devolve True quando a garantia vale.
+"""
+import functools
+import inspect
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_DDL = """
+CREATE TABLE IF NOT EXISTS `schema_garantias` (
+    `nome`          VARCHAR(190) NOT NULL PRIMARY KEY,
+    `versao`        INT          NOT NULL,
+    `verificado_em` DATETIME     NOT NULL DEFAULT CURRENT_TIMESTAMP
+                                 ON UPDATE CURRENT_TIMESTAMP
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+"""
+
+_REGISTRO = {}          # nome -> _Garantia, na ordem de importação
+_verificado = False     # garantir_todas deixou TODAS prontas neste processo
+
+
+class _Garantia:
+    __slots__ = ('nome', 'fn', 'versao', 'persistir', 'com_conn', 'pronta', 'lock')
+
+    def __init__(self, nome, fn, versao, persistir):
+        self.nome = nome
+        self.fn = fn
+        self.versao = versao
+        self.persistir = persistir
+        # fn(conn) recebe a conexão da partida; fn() / fn(conn=None) abre a sua.
+        self.com_conn = any(
+            p.default is inspect.Parameter.empty
+            and p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD)
+            for p in inspect.signature(fn).parameters.values()
+        )
+        self.pronta = False
+        self.lock = threading.Lock()
+
+    def rodar(self, *args, **kwargs):
+        if self.pronta:
+            return True
+        with self.lock:
+            if self.pronta:
+                return True
+            if self.fn(*args, **kwargs) is False:
+                return False
+            self.pronta = True
+            return True
+
+
+def garantia(fn=None, *, versao=1, persistir=True):
+    """Registra fn como garantia de schema. Uso: @garantia ou
+    @garantia(versao=2)."""
+    def registrar(fn):
+        nome = '%s.%s' % (fn.__module__, fn.__name__)
+        g = _REGISTRO[nome] = _Garantia(nome, fn, versao, persistir)
+        global _verificado
+        _verificado = False   # módulo importado depois da partida
+
+        @functools.wraps(fn)
+        def chamar(*args, **kwargs):
+            return g.rodar(*args, **kwargs)
+
+        chamar.garantia = g
+        return chamar
+
+    return registrar(fn) if fn is not None else registrar
+
+
+def schema_verificado():
+    """True quando todas as garantias registradas valem neste processo."""
+    return _verificado
+
+
+def pendentes():
+    return [nome for nome, g in _REGISTRO.items() if not g.pronta]
+
+
+def _versoes_gravadas(cur):
+    cur.execute(_DDL)
+    cur.execute("SELECT nome, versao FROM schema_garantias")
+    return {nome: versao for nome, versao in cur.fetchall()}
+
+
+def garantir_todas(conn):
+    """Roda, uma vez, as garantias que ainda não valem neste processo.
+
+    Chamada por utils.migrations_runner depois dos .sql, com as rotas já
+    importadas. Nunca levanta: garantia que falhar fica para a primeira
+    request que a chamar. Devolve {'puladas', 'rodadas', 'falhas', 'ms'}.
+    """
+    global _verificado
+    t0 = time.perf_counter()
+    cur = conn.cursor()
+    try:
+        gravadas = _versoes_gravadas(cur)
+        conn.commit()
+    except Exception:
+        logger.warning("[schema] schema_garantias indisponível; rodando todas.", exc_info=True)
+        gravadas = {}
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+
+    puladas, rodadas, falhas = 0, 0, []
+    for nome, g in list(_REGISTRO.items()):
+        if g.pronta:
+            continue
+        if g.persistir and gravadas.get(nome, 0) >= g.versao:
+            g.pronta = True
+            puladas += 1
+            continue
+        try:
+            ok = g.rodar(conn) if g.com_conn else g.rodar()
+        except Exception:
+            logger.warning("[schema] %s falhou na partida.", nome, exc_info=True)
+            ok = False
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+        if not ok:
+            falhas.append(nome)
+            continue
+        rodadas += 1
+        if g.persistir:
+            try:
+                cur.execute(
+                    "INSERT INTO schema_garantias (nome, versao) VALUES (%s, %s) "
+                    "ON DUPLICATE KEY UPDATE versao = VALUES(versao), verificado_em = NOW()",
+                    (nome, g.versao),
+                )
+                conn.commit()
+            except Exception:
+                logger.warning("[schema] não gravou %s.", nome, exc_info=True)
+    cur.close()
+
+    _verificado = not falhas and not pendentes()
+    ms = (time.perf_counter() - t0) * 1000
+    logger.info("[schema] garantias: %d já verificadas, %d rodadas, %d falha(s) em %.0f ms.",
+                puladas, rodadas, len(falhas), ms)
+    return {'puladas': puladas, 'rodadas': rodadas, 'falhas': falhas, 'ms': ms}